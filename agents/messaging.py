@@ -1,67 +1,60 @@
 # agents/messaging.py
-import json
+import asyncio
 import uuid
 from typing import Dict, Any, Optional
-import redis
 from django.conf import settings
-from .models import Agent, AgentMessage
+from apps.agents.audit import message_audit
+from apps.core.messaging import BACKEND_REDIS, MessageBus as CoreMessageBus
+from .models import Agent
 
 
 class MessageBus:
-    """سیستم پیام‌رسان بین عامل‌ها"""
+    """سیستم پیام‌رسان بین عامل‌ها (روی MessageBus هسته)"""
 
-    def __init__(self):
-        self.redis_client = redis.Redis(
-            host=settings.REDIS_HOST,
-            port=settings.REDIS_PORT,
-            db=settings.REDIS_DB
-        )
+    def __init__(self, broker_type: Optional[str] = None, audit=None):
+        self.bus = CoreMessageBus(broker_type=broker_type or getattr(settings, 'AGENT_RUNTIME_BUS_BACKEND', BACKEND_REDIS))
+        # ثبت پیام‌ها در AgentMessage بیرون از مسیر انتشار و طبق سیاست هر topic انجام می‌شود
+        self.audit = audit or message_audit
 
     def publish(self, sender: Agent, receiver: Agent, message_type: str, payload: Dict[str, Any],
                 correlation_id: Optional[str] = None) -> str:
         """ارسال پیام از یک عامل به عامل دیگر"""
-        message_id = str(uuid.uuid4())
         correlation_id = correlation_id or str(uuid.uuid4())
+        topic = f"agent:{receiver.id}"
 
-        # ذخیره پیام در دیتابیس برای لاگ و ردیابی
-        AgentMessage.objects.create(
-            sender=sender,
-            receiver=receiver,
-            message_type=message_type,
-            payload=payload,
-            correlation_id=correlation_id
-        )
-
-        # ارسال پیام به Redis
         message_data = {
-            "message_id": message_id,
             "sender_id": sender.id,
             "receiver_id": receiver.id,
             "message_type": message_type,
             "payload": payload,
             "correlation_id": correlation_id
         }
+        message_id = self.bus.publish_sync(topic, message_data, message_type=message_type,
+                                           sender_id=str(sender.id), correlation_id=correlation_id)
 
-        channel = f"agent:{receiver.id}"
-        self.redis_client.publish(channel, json.dumps(message_data))
-
+        # لاگ و ردیابی: فقط صف‌گذاری؛ نوشتن در دیتابیس به صورت batch در پس‌زمینه
+        self.audit.record(message_id, sender.id, receiver.id, message_type, payload,
+                          correlation_id=correlation_id, topic=topic)
         return message_id
 
     def subscribe(self, agent: Agent, callback):
-        """اشتراک عامل برای دریافت پیام‌ها"""
-        channel = f"agent:{agent.id}"
-        pubsub = self.redis_client.pubsub()
-        pubsub.subscribe(channel)
-
-        for message in pubsub.listen():
-            if message['type'] == 'message':
-                data = json.loads(message['data'])
-                # علامت‌گذاری پیام به عنوان پردازش شده
-                AgentMessage.objects.filter(
-                    sender_id=data["sender_id"],
-                    receiver_id=data["receiver_id"],
-                    correlation_id=data["correlation_id"]
-                ).update(processed=True)
-
-                # فراخوانی تابع پردازش پیام
-                callback(data)
\ No newline at end of file
+        """اشتراک عامل برای دریافت پیام‌ها (مسدودکننده)"""
+        asyncio.run(self._consume(agent, callback))
+
+    async def _consume(self, agent: Agent, callback):
+        def process(message_id, topic, data):
+            # در نخ جدا اجرا می‌شود؛ callback ممکن است ORM فراخوانی کند
+            callback(data)
+            # علامت‌گذاری پیام به عنوان پردازش شده (batch، بدون UPDATE به ازای هر پیام)
+            self.audit.mark_processed(message_id, topic, data["message_type"], data["correlation_id"], data["payload"])
+
+        async def handle(message):
+            data = dict(message.payload, message_id=message.message_id)
+            await asyncio.to_thread(process, message.message_id, message.topic, data)
+
+        subscription = await self.bus.subscribe(f"agent:{agent.id}", handle, group=f"agent-{agent.id}")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await subscription.stop()
+            await self.bus.close()
@@ -4,6 +4,7 @@ from datetime import datetime
 from typing import Dict, Any
 from .messaging import MessageBus
 from apps.agents.models import Agent as AgentModel  # مدلی که قبلاً ساختیم
+from apps.market_data.hot_cache import hot_market_cache
 
 logger = logging.getLogger(__name__)
 
@@ -149,7 +150,19 @@ class RiskAgent(BaseAgent):
             self.send_message("risk.approved", {"signal_id": signal.get("id")})
 
     def is_risky(self, data: Dict[str, Any]) -> bool:
-        # منطق بررسی ریسک
+        # منطق بررسی ریسک: انحراف قیمت سیگنال از آخرین قیمت بازار (از کش داغ، بدون کوئری پایگاه داده)
+        symbol, price = data.get("symbol"), data.get("price")
+        if not symbol or price is None:
+            return False
+        max_deviation = float(self.config.get("max_price_deviation_pct", 5.0))
+        max_age_ms = int(self.config.get("max_price_age_ms", 5000))
+        latest = hot_market_cache.get_latest_price(symbol, source=data.get("exchange"), max_age_ms=max_age_ms)
+        if latest is None:
+            return False
+        deviation = abs(float(price) - latest[0]) / latest[0] * 100 if latest[0] else 0.0
+        if deviation > max_deviation:
+            logger.warning(f"Signal {data.get('id')} price {price} deviates {deviation:.2f}% from market {latest[0]} for {symbol}.")
+            return True
         return False
 
 
@@ -162,7 +175,19 @@ class ExecutionAgent(BaseAgent):
         # self.message_bus.subscribe("orders.pending", self.on_order_pending)
 
     def on_order_pending(self, order: Dict[str, Any]):
-        # ارسال به کانکتور صرافی
-        # result = self.execute_order(order)
-        # self.send_message("orders.executed", result)
-        pass
\ No newline at end of file
+        # ارسال از طریق نشست گرم گیت‌وی اجرا (در دسترس نبودن گیت‌وی: place_order_task در Celery)
+        from apps.exchanges.gateway import submit_live_order  # Import داخل تابع برای جلوگیری از حلقه
+
+        account_id = order.get("account_id") or self.config.get("exchange_account_id")
+        order_params = order.get("order") or order.get("order_params")
+        if account_id is None or not order_params:
+            logger.error(f"ExecutionAgent {self.name} got an order without account or parameters: {order.get('id')}")
+            result = {"status": "rejected", "error": "missing account_id or order parameters"}
+        else:
+            try:
+                result = submit_live_order(account_id, order.get("bot_id"), order_params, tick_ts=order.get("tick_ts"))
+            except Exception as e:
+                # سفارش ممکن است به صرافی رسیده باشد؛ تکرار خودکار انجام نمی‌شود
+                logger.error(f"ExecutionAgent {self.name} could not submit order {order.get('id')}: {e}")
+                result = {"status": "rejected", "error": str(e)}
+        self.send_message("orders.executed", dict(result, order_id=order.get("id")))
\ No newline at end of file
@@ -1,35 +1,44 @@
 # apps/agent_runtime/messaging.py
-import json
-import redis
+import asyncio
 from django.conf import settings
 from typing import Dict, Any, Callable
 
-# تنظیمات Redis از settings
-REDIS_HOST = getattr(settings, 'REDIS_HOST', 'localhost')
-REDIS_PORT = getattr(settings, 'REDIS_PORT', 6379)
-REDIS_DB = getattr(settings, 'REDIS_DB', 0)
+from apps.core.messaging import BACKEND_REDIS, MessageBus as CoreMessageBus
+
+# عامل‌های runtime در پروسس‌های جدا (Celery) اجرا می‌شوند؛ پیش‌فرض Redis Streams است
+AGENT_RUNTIME_BUS_BACKEND = getattr(settings, 'AGENT_RUNTIME_BUS_BACKEND', BACKEND_REDIS)
 
-r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB, decode_responses=True)
 
 class MessageBus:
     """
-    لایه انتزاعی برای ارسال و دریافت پیام بین عامل‌ها.
+    لایه انتزاعی همگام برای ارسال و دریافت پیام بین عامل‌ها، روی MessageBus هسته.
     """
+    def __init__(self, broker_type: str = None):
+        self.bus = CoreMessageBus(broker_type=broker_type or AGENT_RUNTIME_BUS_BACKEND)
+
     def publish(self, topic: str, message: Dict[str, Any]):
         """
         انتشار یک پیام در یک موضوع (topic).
         """
-        r.publish(topic, json.dumps(message))
+        return self.bus.publish_sync(topic, message, message_type=message.get('type'))
 
-    def subscribe(self, topic: str, callback: Callable[[Dict[str, Any]], None]):
+    def subscribe(self, topic: str, callback: Callable[[Dict[str, Any]], None], group: str = None):
         """
         اشتراک در یک موضوع و فراخوانی یک تابع هنگام دریافت پیام.
-        این تابع باید در یک فرآیند جداگانه یا ترد اجرا شود.
+        این تابع مسدودکننده است و باید در یک فرآیند جداگانه یا ترد اجرا شود.
+        مصرف‌کننده‌های یک group پیام‌ها را بین خود تقسیم می‌کنند.
         """
-        pubsub = r.pubsub()
-        pubsub.subscribe(topic)
+        asyncio.run(self._consume(topic, callback, group or topic))
+
+    async def _consume(self, topic: str, callback: Callable[[Dict[str, Any]], None], group: str):
+        async def handle(message):
+            # callback همگام است (ممکن است ORM فراخوانی کند)؛ بیرون از event loop اجرا می‌شود
+            await asyncio.to_thread(callback, message.payload)
 
-        for message in pubsub.listen():
-            if message['type'] == 'message':
-                data = json.loads(message['data'])
-                callback(data)
\ No newline at end of file
+        subscription = await self.bus.subscribe(topic, handle, group=group)
+        try:
+            # تا لغو شدن (یا پایان پروسس) منتظر می‌ماند
+            await asyncio.Event().wait()
+        finally:
+            await subscription.stop()
+            await self.bus.close()
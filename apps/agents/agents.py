@@ -3,18 +3,19 @@ import asyncio
 import json
 import logging
 import ssl
-from datetime import datetime
-from decimal import Decimal
+import time
 from typing import Dict, Any, List, Optional
 from django.conf import settings
-from django.utils import timezone
 import websockets
 import aiohttp
-from apps.agents.models import Agent, AgentStatus, AgentMessage, AgentLog, AgentMetric
-from apps.market_data.models import DataSource, MarketDataConfig, MarketDataSnapshot, MarketDataSyncLog
+from apps.agents.models import Agent, AgentStatus, AgentMessage
+from apps.market_data.models import DataSource, MarketDataConfig, MarketDataSyncLog
 from apps.instruments.models import Instrument
 from apps.connectors.models import APICredential
 from apps.core.messaging import MessageBus  # فرض می‌کنیم یک کلاس یکپارچه برای پیام‌رسانی دارید
+from channels.db import database_sync_to_async
+from apps.market_data.normalizers import resolve_normalizer
+from .ingest import KIND_LOG, KIND_SNAPSHOT, AgentIngestPipeline, get_agent_ingest_settings, snapshot_record
 
 logger = logging.getLogger(__name__)
 
@@ -25,7 +26,7 @@ class MarketDataAgent:
     - قابلیت اتصال به چندین صرافی.
     - استفاده از الگوی آداپتور برای کانکتورها.
     - پشتیبانی از WebSocket و REST.
-    - ذخیره داده در PostgreSQL/TimescaleDB.
+    - ذخیره داده در PostgreSQL/TimescaleDB از طریق صف و نویسنده‌های batch (بدون ORM در حلقه رویداد).
     - ارسال داده به سایر عامل‌ها از طریق MessageBus.
     - مدیریت اشتراک‌ها و محدودیت‌های نرخ.
     - امنیت (رمزنگاری، اعتبارسنجی، لاگ).
@@ -42,6 +43,7 @@ class MarketDataAgent:
         self.active_websockets = {}  # {config_id: websocket_connection}
         self.rate_limit_buckets = {}  # {source_id: {'count': int, 'reset_time': datetime}}
         self.subscriptions = set()  # {(instrument_id, source_id, timeframe, data_type)}
+        self.ingest = AgentIngestPipeline(self.agent_model.id, get_agent_ingest_settings(self.config))
 
     def start(self):
         logger.info(f"MarketDataAgent {self.agent_model.name} started.")
@@ -64,22 +66,32 @@ class MarketDataAgent:
         """
         حلقه اصلی: بارگذاری کانفیگ، اتصال، دریافت، نرمالایز، ذخیره، ارسال.
         """
-        # 1. بارگذاری تمام کانفیگ‌های فعال
-        configs = MarketDataConfig.objects.filter(
+        # 1. بارگذاری تمام کانفیگ‌های فعال (کوئری در نخ جداگانه، نه در حلقه رویداد)
+        configs = await database_sync_to_async(self._load_pending_configs)()
+
+        await self.ingest.start()
+        streams = []
+        try:
+            for config in configs:
+                self.subscriptions.add((
+                    config.instrument_id,
+                    config.data_source_id,
+                    config.timeframe,
+                    config.data_type
+                ))
+                if config.data_source.type == 'WEBSOCKET':
+                    # 2. برای کانکتورهای WebSocket، یک تسک ایجاد کن
+                    streams.append(asyncio.create_task(self._run_websocket_stream(config)))
+                # 3. برای REST می‌توانید تسک‌های دوره‌ای (cron-like) ایجاد کنید یا در صورت نیاز فراخوانی کنید.
+            await asyncio.gather(*streams)
+        finally:
+            await self.ingest.close()
+
+    @staticmethod
+    def _load_pending_configs():
+        return list(MarketDataConfig.objects.filter(
             status='PENDING'
-        ).select_related('instrument', 'data_source', 'api_credential')
-
-        for config in configs:
-            self.subscriptions.add((
-                config.instrument_id,
-                config.data_source_id,
-                config.timeframe,
-                config.data_type
-            ))
-            if config.data_source.type == 'WEBSOCKET':
-                # 2. برای کانکتورهای WebSocket، یک تسک ایجاد کن
-                asyncio.create_task(self._run_websocket_stream(config))
-            # 3. برای REST می‌توانید تسک‌های دوره‌ای (cron-like) ایجاد کنید یا در صورت نیاز فراخوانی کنید.
+        ).select_related('instrument', 'data_source', 'api_credential'))
 
     async def _run_websocket_stream(self, config: MarketDataConfig):
         """
@@ -96,13 +108,19 @@ class MarketDataAgent:
             credential=config.api_credential,
             agent=self
         )
+        # نرمالایزر یک بار هنگام اشتراک انتخاب می‌شود، نه برای هر پیام
+        normalizer = resolve_normalizer(config)
+        if normalizer is None:
+            logger.error(f"No normalizer for {config.data_source.name}/{config.data_type}")
+            self._log_agent_message(f"No normalizer for {config.data_source.name}/{config.data_type}", level="ERROR")
+            return
 
         while self.is_running:
             try:
                 await connector.connect()
                 logger.info(f"Connected to {config.data_source.name} for {config.instrument.symbol}")
                 async for message in connector.listen():
-                    await self._process_raw_message(message, config)
+                    await self._process_raw_message(message, config, normalizer)
 
             except websockets.exceptions.ConnectionClosed:
                 logger.warning(f"WebSocket to {config.data_source.name} closed. Reconnecting...")
@@ -112,88 +130,44 @@ class MarketDataAgent:
                 self._log_agent_message(str(e), level="ERROR")
                 await asyncio.sleep(10)
 
-    async def _process_raw_message(self, raw_data: Dict[str, Any], config: MarketDataConfig):
+    async def _process_raw_message(self, raw_data: Dict[str, Any], config: MarketDataConfig, normalizer):
         """
-        پردازش یک پیام خام از WebSocket و تبدیل، ذخیره و ارسال آن.
+        پردازش یک پیام خام از WebSocket: نرمالایز، قرار دادن در صف ذخیره و ارسال.
         """
+        started = time.perf_counter()
         try:
             # 1. نرمالایز کردن داده
-            normalized_data = self._normalize_data(raw_data, config.data_source.name, config.data_type)
-
-            # 2. ذخیره در دیتابیس
-            snapshot = MarketDataSnapshot.objects.create(
-                config=config,
-                timestamp=timezone.make_aware(datetime.fromtimestamp(normalized_data['timestamp'])),
-                open_price=normalized_data['open'],
-                high_price=normalized_data['high'],
-                low_price=normalized_data['low'],
-                close_price=normalized_data['close'],
-                volume=normalized_data['volume'],
-                best_bid=normalized_data.get('best_bid'),
-                best_ask=normalized_data.get('best_ask'),
-                bid_size=normalized_data.get('bid_size'),
-                ask_size=normalized_data.get('ask_size'),
-                additional_data=normalized_data.get('additional_data', {})
-            )
+            normalized_data = normalizer.normalize(raw_data)
+            if normalized_data is None:
+                return  # پیام بدون داده (مثلاً تأیید اشتراک)
+            record = snapshot_record(config, normalized_data)
+
+            # 2. قرار دادن در صف ذخیره (با backpressure در صورت عقب ماندن نویسنده‌ها)
+            await self.ingest.submit(KIND_SNAPSHOT, record)
 
             # 3. ارسال به سایر عامل‌ها از طریق MessageBus
             topic = f"market.{config.instrument.symbol}.{config.timeframe}"
             payload = {
-                "instrument_id": config.instrument.id,
+                "instrument_id": str(config.instrument_id),
                 "symbol": config.instrument.symbol,
-                "timestamp": snapshot.timestamp.isoformat(),
-                "open": float(snapshot.open_price),
-                "high": float(snapshot.high_price),
-                "low": float(snapshot.low_price),
-                "close": float(snapshot.close_price),
-                "volume": float(snapshot.volume),
+                "timestamp": record['timestamp'],
+                "open": float(record['open']),
+                "high": float(record['high']),
+                "low": float(record['low']),
+                "close": float(record['close']),
+                "volume": float(record['volume']),
                 "source": config.data_source.name,
             }
             await self.message_bus.publish(topic, payload)
 
-            # 4. لاگ و متریک
-            self._log_agent_message(f"Stored and published snapshot for {config.instrument.symbol}", level="INFO")
-            self._update_metrics(config.instrument.symbol)
+            # 4. متریک (شمارنده‌ها دوره‌ای در AgentMetric ثبت می‌شوند، نه یک لاگ برای هر پیام)
+            self.ingest.count_message((time.perf_counter() - started) * 1000)
 
         except Exception as e:
             logger.error(f"Error processing message for {config}: {e}")
+            self.ingest.count_message((time.perf_counter() - started) * 1000, error=True)
             self._log_agent_message(f"Error processing message: {e}", level="ERROR")
 
-    def _normalize_data(self, raw_data: Dict[str, Any], source_name: str, data_type: str) -> Dict[str, Any]:
-        """
-        تبدیل داده خام از هر صرافی به یک فرمت یکنواخت.
-        این تابع باید بر اساس source_name و data_type منطق متفاوتی داشته باشد.
-        """
-        # مثال ساده برای OHLCV
-        if data_type == 'OHLCV':
-            # نگاشت فیلدها از هر صرافی به فرمت استاندارد
-            if source_name.upper() == 'BINANCE':
-                return {
-                    "timestamp": raw_data['k']['T'],
-                    "open": Decimal(raw_data['k']['o']),
-                    "high": Decimal(raw_data['k']['h']),
-                    "low": Decimal(raw_data['k']['l']),
-                    "close": Decimal(raw_data['k']['c']),
-                    "volume": Decimal(raw_data['k']['v']),
-                }
-            elif source_name.upper() == 'NOBITEX':
-                # منطق نرمالایز Nobitex
-                return {
-                    "timestamp": raw_data['t'],
-                    "open": Decimal(raw_data['o']),
-                    "high": Decimal(raw_data['h']),
-                    "low": Decimal(raw_data['l']),
-                    "close": Decimal(raw_data['c']),
-                    "volume": Decimal(raw_data['v']),
-                }
-            # ... سایر صرافی‌ها
-
-        elif data_type == 'TICK':
-            # منطق برای TICK
-            pass
-
-        return raw_data # اگر نرمالایز نشد، همان داده را برگردان
-
     def _get_connector_class(self, source_name: str):
         """
         بازیابی کلاس کانکتور مربوط به یک منبع داده.
@@ -203,15 +177,12 @@ class MarketDataAgent:
         return get_connector(source_name.upper())
 
     def _log_agent_message(self, message: str, level: str = "INFO"):
-        AgentLog.objects.create(
-            agent=self.agent_model,
-            level=level,
-            message=message,
-            extra_data={"source": "MarketDataAgent"},
-        )
-
-    def _update_metrics(self, symbol: str):
-        # مثلاً افزایش تعداد پیام دریافتی
-        # باید یک مدل AgentMetric داشته باشید
-        # AgentMetric.objects.update_or_create(...)
-        pass
\ No newline at end of file
+        # لاگ از طریق صف ذخیره می‌شود؛ اگر صف فعال نباشد یا پر باشد فقط در logger می‌ماند
+        queued = self.ingest.offer(KIND_LOG, {
+            "agent_id": str(self.agent_model.id),
+            "level": level,
+            "message": message,
+            "extra_data": {"source": "MarketDataAgent"},
+        })
+        if not queued:
+            logger.warning(f"Agent log not persisted ({level}): {message}")
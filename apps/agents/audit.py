@@ -0,0 +1,389 @@
+# apps/agents/audit.py
+
+"""
+Audit sink of inter-agent messages.
+
+Publishing a message never touches the database: record() decides, from the topic's policy,
+whether the message is kept and hands a JSON-safe row to an AgentIngestPipeline running on a
+background thread. Rows are written with bulk_create in batches; when the database falls
+behind, the pipeline spills them to JSONL segments on local disk and replays them later.
+
+Policies are looked up by topic, then by message type (exact names first, then fnmatch
+patterns, most specific first):
+    always       - every message is stored
+    sampled:<N>  - N percent of messages; the decision is a hash of the correlation id (the
+                   message id when there is none), so a correlation chain is stored completely
+                   or not at all and record() / mark_processed() agree on every message
+    errors       - only error messages (message type containing ERROR, an 'error' key in the
+                   payload or an explicit error)
+    never        - nothing is stored
+The bus message id is used as the AgentMessage primary key, so rows can be looked up by
+message id as well as by correlation id (indexed).
+"""
+
+import asyncio
+import atexit
+import fnmatch
+import functools
+import logging
+import threading
+import uuid
+import zlib
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+from apps.core.metrics import metrics
+
+from .ingest import POLICY_SPILL, AgentIngestPipeline, get_agent_ingest_settings
+
+logger = logging.getLogger(__name__)
+
+METRIC_PREFIX = 'agents.message_audit'
+
+KIND_MESSAGE = 'agent_message'
+OP_CREATE = 'create'
+OP_PROCESSED = 'processed'
+
+POLICY_ALWAYS = 'always'
+POLICY_SAMPLED = 'sampled'
+POLICY_ERRORS = 'errors'
+POLICY_NEVER = 'never'
+AUDIT_POLICIES = (POLICY_ALWAYS, POLICY_SAMPLED, POLICY_ERRORS, POLICY_NEVER)
+
+# تنظیمات پیش‌فرض؛ settings.AGENT_MESSAGE_AUDIT آن‌ها را بازنویسی می‌کند
+DEFAULT_AGENT_MESSAGE_AUDIT = {
+    'default_policy': POLICY_ALWAYS,
+    'policies': {},                 # الگوی topic یا message_type -> 'always' | 'sampled:<درصد>' | 'errors' | 'never'
+    'queue_size': 10000,
+    'max_batch_size': 500,
+    'max_latency_ms': 500,
+    'overflow_policy': POLICY_SPILL,
+    'spill_dir': None,              # پیش‌فرض: settings.AGENT_INGEST_SPILL_DIR
+    'max_spill_bytes': 256 * 1024 * 1024,
+    'close_timeout_seconds': 10,
+    # نشانه processed پیامی که ردیفش هنوز (در پروسس دیگر) نوشته نشده دوباره صف می‌شود
+    'marker_retries': 5,
+    'marker_retry_seconds': 2.0,
+}
+
+
+def get_agent_message_audit_settings() -> Dict[str, Any]:
+    merged = dict(DEFAULT_AGENT_MESSAGE_AUDIT)
+    merged.update(getattr(settings, 'AGENT_MESSAGE_AUDIT', {}) or {})
+    return merged
+
+
+def parse_policy(spec: str) -> Tuple[str, float]:
+    """
+    'always' / 'never' / 'errors' / 'sampled:<percent>' -> (policy, percent stored).
+    """
+    name, _, rate = str(spec).strip().lower().partition(':')
+    if name == POLICY_SAMPLED:
+        try:
+            return POLICY_SAMPLED, min(100.0, max(0.0, float(rate or 0)))
+        except ValueError:
+            pass
+    elif name in AUDIT_POLICIES and not rate:
+        return name, 100.0 if name == POLICY_ALWAYS else 0.0
+    raise ValueError(f"Invalid agent message audit policy: {spec!r}")
+
+
+def is_error_message(message_type: str, payload: Any, error: Optional[str] = None) -> bool:
+    return bool(error) or 'ERROR' in (message_type or '').upper() or (isinstance(payload, dict) and bool(payload.get('error')))
+
+
+class AuditPolicies:
+    """
+    Resolves the policy of a (topic, message type); resolutions are cached per key.
+    """
+
+    def __init__(self, policies: Optional[Dict[str, str]] = None, default: str = POLICY_ALWAYS):
+        self.default = parse_policy(default)
+        parsed = {pattern: parse_policy(spec) for pattern, spec in (policies or {}).items()}
+        self._exact = {pattern: policy for pattern, policy in parsed.items() if not any(c in pattern for c in '*?[')}
+        # الگوهای طولانی‌تر (خاص‌تر) اول بررسی می‌شوند
+        self._patterns = sorted(
+            ((pattern, policy) for pattern, policy in parsed.items() if pattern not in self._exact),
+            key=lambda item: -len(item[0]),
+        )
+        self._cache: Dict[str, Optional[Tuple[str, float]]] = {}
+
+    def _lookup(self, key: str) -> Optional[Tuple[str, float]]:
+        if key in self._cache:
+            return self._cache[key]
+        policy = self._exact.get(key)
+        if policy is None:
+            policy = next((policy for pattern, policy in self._patterns if fnmatch.fnmatchcase(key, pattern)), None)
+        self._cache[key] = policy
+        return policy
+
+    def resolve(self, topic: str = '', message_type: str = '') -> Tuple[str, float]:
+        return (topic and self._lookup(topic)) or (message_type and self._lookup(message_type)) or self.default
+
+    def should_record(self, topic: str, message_type: str, correlation_id: str = '', payload: Any = None,
+                      error: Optional[str] = None, message_id: str = '') -> bool:
+        policy, percent = self.resolve(topic, message_type)
+        if policy == POLICY_ALWAYS:
+            return True
+        if policy == POLICY_NEVER:
+            return False
+        if policy == POLICY_ERRORS:
+            return is_error_message(message_type, payload, error)
+        if percent >= 100:
+            return True
+        # تصمیم نمونه‌برداری روی correlation_id (در نبود آن شناسه پیام) ثابت است تا زنجیره پیام‌ها کامل بماند
+        bucket = zlib.crc32(str(correlation_id or message_id).encode()) % 10000
+        return bucket < percent * 100
+
+
+def message_record(message_id: str, sender_id, receiver_id, message_type: str, payload: Any, correlation_id: str = '',
+                   topic: str = '', priority: int = 2, error: Optional[str] = None) -> Dict[str, Any]:
+    """
+    JSON-safe AgentMessage row for the audit queue.
+    """
+    if error and isinstance(payload, dict):
+        payload = dict(payload, error=str(error))
+    return {
+        'op': OP_CREATE,
+        'id': str(message_id),
+        'sender_id': str(sender_id),
+        'receiver_id': str(receiver_id),
+        'message_type': message_type,
+        'topic': topic,
+        'payload': payload if isinstance(payload, dict) else {'value': payload},
+        'priority': priority,
+        'correlation_id': correlation_id or '',
+    }
+
+
+def write_agent_messages(records: List[Dict[str, Any]], requeue: Optional[Callable] = None) -> int:
+    """
+    Bulk inserts message rows, then marks processed ones (in queue order, so a row precedes its marker).
+    Markers whose row does not exist yet (written by another process) are handed to requeue.
+    """
+    from .models import AgentMessage # Import داخل تابع برای جلوگیری از حلقه
+
+    created = [record for record in records if record['op'] == OP_CREATE]
+    # بازپخش spill پس از خرابی ممکن است ردیف تکراری بفرستد؛ کلید اصلی همان message_id است
+    AgentMessage.objects.bulk_create([
+        AgentMessage(
+            id=record['id'],
+            sender_id=record['sender_id'],
+            receiver_id=record['receiver_id'],
+            message_type=record['message_type'],
+            topic=record['topic'],
+            payload=record['payload'],
+            priority=record['priority'],
+            correlation_id=record['correlation_id'],
+        )
+        for record in created
+    ], batch_size=1000, ignore_conflicts=True)
+    markers = [record for record in records if record['op'] == OP_PROCESSED]
+    if markers:
+        found = set(AgentMessage.objects.filter(id__in=[record['id'] for record in markers]).values_list('id', flat=True))
+        if found:
+            AgentMessage.objects.filter(id__in=found, processed=False).update(processed=True)
+        missing = [record for record in markers if uuid.UUID(record['id']) not in found]
+        if missing and requeue is not None:
+            requeue(missing)
+    return len(records)
+
+
+class AgentMessageAuditSink:
+    """
+    Process-wide, thread-safe front of the audit pipeline; the pipeline runs on its own event loop thread.
+    """
+
+    def __init__(self, options: Optional[Dict[str, Any]] = None, writer: Callable = write_agent_messages,
+                 name: str = 'messages'):
+        self._options = options
+        self._policies: Optional[AuditPolicies] = None
+        self._writer = writer
+        self.name = name
+        self.pipeline: Optional[AgentIngestPipeline] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._submit_lock: Optional[asyncio.Lock] = None
+        self.stats = {'recorded': 0, 'skipped': 0, 'dropped': 0}
+
+    @property
+    def options(self) -> Dict[str, Any]:
+        if self._options is None:
+            self._options = get_agent_message_audit_settings()
+        return self._options
+
+    @property
+    def policies(self) -> AuditPolicies:
+        if self._policies is None:
+            self._policies = AuditPolicies(self.options['policies'], self.options['default_policy'])
+        return self._policies
+
+    # --- چرخه حیات ---
+
+    def _pipeline_options(self) -> Dict[str, Any]:
+        ingest = get_agent_ingest_settings()
+        for key in ('queue_size', 'max_batch_size', 'max_latency_ms', 'overflow_policy', 'max_spill_bytes',
+                    'close_timeout_seconds'):
+            ingest[key] = self.options[key]
+        if self.options['spill_dir']:
+            ingest['spill_dir'] = self.options['spill_dir']
+        # یک shard تا ردیف پیام همیشه پیش از نشانه processed آن نوشته شود
+        ingest['writers'] = 1
+        return ingest
+
+    def _ensure_started(self) -> bool:
+        if self._loop is not None:
+            return True
+        with self._lock:
+            if self._loop is not None:
+                return True
+            loop = asyncio.new_event_loop()
+            writer = functools.partial(self._writer, requeue=self._requeue_markers)
+            pipeline = AgentIngestPipeline(self.name, self._pipeline_options(), writers={KIND_MESSAGE: writer})
+            ready = threading.Event()
+
+            def run():
+                asyncio.set_event_loop(loop)
+                try:
+                    self._submit_lock = asyncio.Lock()
+                    loop.run_until_complete(pipeline.start())
+                except Exception as e:
+                    logger.error(f"Agent message audit sink failed to start: {e}")
+                    return
+                finally:
+                    ready.set()
+                loop.run_forever()
+
+            thread = threading.Thread(target=run, name='agent-message-audit', daemon=True)
+            thread.start()
+            ready.wait(10)
+            if not pipeline.is_running:
+                return False
+            self.pipeline, self._thread, self._loop = pipeline, thread, loop
+        # ردیف‌های صف‌شده هنگام خروج پروسس نوشته (یا روی دیسک ریخته) می‌شوند
+        atexit.register(self.close)
+        return True
+
+    def close(self, timeout: Optional[float] = None):
+        """
+        Writes queued rows (spilled segments stay on disk for the next start) and stops the writer thread.
+        """
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+        future = asyncio.run_coroutine_threadsafe(self._close_pipeline(), loop)
+        try:
+            future.result(timeout or self.options['close_timeout_seconds'] + 5)
+        except Exception as e:
+            logger.error(f"Error closing agent message audit sink: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+        self._thread.join(5)
+        loop.close()
+
+    async def _close_pipeline(self):
+        async with self._submit_lock:
+            pass
+        await self.pipeline.close()
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """
+        Blocks until rows queued so far are written (for tests and shutdown hooks).
+        """
+        loop = self._loop
+        if loop is None:
+            return True
+        return asyncio.run_coroutine_threadsafe(self._drain(timeout), loop).result(timeout + 1)
+
+    async def _drain(self, timeout: float) -> bool:
+        # پس از رکوردهایی که منتظر قفل ثبت هستند نوبت می‌گیرد
+        async with self._submit_lock:
+            pass
+        return await self.pipeline.drain(timeout)
+
+    # --- ثبت (در مسیر انتشار؛ بدون ORM و بدون انتظار) ---
+
+    def _submit(self, record: Dict[str, Any]) -> bool:
+        if not self._ensure_started():
+            self._dropped()
+            return False
+        self._loop.call_soon_threadsafe(self._enqueue, record)
+        return True
+
+    def _enqueue(self, record: Dict[str, Any]):
+        if self.pipeline.options['overflow_policy'] == POLICY_SPILL:
+            # submit() تا نوشتن segment روی دیسک منتظر می‌ماند تا بافر spill سرریز نشود
+            self._loop.create_task(self._submit_spilling(record))
+        elif not self.pipeline.offer(KIND_MESSAGE, record):
+            self._dropped()
+
+    async def _submit_spilling(self, record: Dict[str, Any]):
+        # قفل asyncio به ترتیب ورود آزاد می‌شود؛ ترتیب رکوردها حفظ می‌شود
+        async with self._submit_lock:
+            stored = await self.pipeline.submit(KIND_MESSAGE, record)
+        if not stored:
+            self._dropped()
+
+    def _dropped(self):
+        self.stats['dropped'] += 1
+        metrics.incr(f'{METRIC_PREFIX}.dropped')
+
+    def _requeue_markers(self, markers: List[Dict[str, Any]]):
+        """
+        Called from the writer thread with processed markers that matched no row; they are queued
+        again after marker_retry_seconds, up to marker_retries times.
+        """
+        retry = []
+        for marker in markers:
+            attempts = marker.get('attempts', 0) + 1
+            if attempts > self.options['marker_retries']:
+                metrics.incr(f'{METRIC_PREFIX}.unmatched_markers')
+                logger.warning(f"Processed marker of message {marker['id']} matched no AgentMessage row; dropped.")
+                continue
+            retry.append(dict(marker, attempts=attempts))
+        loop = self._loop
+        if not retry or loop is None or loop.is_closed():
+            return
+        metrics.incr(f'{METRIC_PREFIX}.requeued_markers', len(retry))
+        loop.call_soon_threadsafe(loop.call_later, self.options['marker_retry_seconds'], self._enqueue_many, retry)
+
+    def _enqueue_many(self, records: List[Dict[str, Any]]):
+        if self._loop is None:
+            return
+        for record in records:
+            self._enqueue(record)
+
+    def record(self, message_id: str, sender_id, receiver_id, message_type: str, payload: Any,
+               correlation_id: str = '', topic: str = '', priority: int = 2, error: Optional[str] = None) -> bool:
+        """
+        Queues an AgentMessage row if the topic's policy keeps this message; returns whether it was queued.
+        """
+        if not self.policies.should_record(topic, message_type, correlation_id or '', payload, error, str(message_id)):
+            self.stats['skipped'] += 1
+            metrics.incr(f'{METRIC_PREFIX}.skipped')
+            return False
+        queued = self._submit(message_record(message_id, sender_id, receiver_id, message_type, payload,
+                                             correlation_id, topic, priority, error))
+        if queued:
+            self.stats['recorded'] += 1
+            metrics.incr(f'{METRIC_PREFIX}.recorded')
+        return queued
+
+    def mark_processed(self, message_id: str, topic: str = '', message_type: str = '', correlation_id: str = '',
+                       payload: Any = None, error: Optional[str] = None) -> bool:
+        """
+        Queues the processed flag of a delivered message (only if its row was kept by the policy).
+        Pass the same payload and error as to record() so both make the same decision.
+        """
+        if not self.policies.should_record(topic, message_type, correlation_id or '', payload, error, str(message_id)):
+            return False
+        return self._submit({'op': OP_PROCESSED, 'id': str(message_id)})
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, 'pipeline': self.pipeline.get_stats() if self.pipeline is not None else None}
+
+
+# سینک سراسری در سطح پروسس
+message_audit = AgentMessageAuditSink()
@@ -0,0 +1,549 @@
+# apps/agents/ingest.py
+
+"""
+Async ingest pipeline of market data agents.
+
+Socket readers never touch the ORM: they put JSON-safe records (snapshot rows, agent logs) on
+bounded asyncio queues and return. Writer coroutines drain the queues in batches (size or
+latency threshold) and persist each batch with bulk statements on a dedicated thread pool.
+Records are sharded by key (config id for snapshots), so updates of one series are written
+in order while shards are written concurrently.
+
+When writers fall behind, overflow_policy decides what happens to new records:
+    block       - the reader awaits free space (backpressure to the socket)
+    drop_newest - the new record is dropped
+    drop_oldest - the oldest queued record of the shard is dropped
+    spill       - records go to JSONL segments on disk and are replayed once the queues drain
+"""
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F
+from django.utils import timezone
+
+from apps.core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+METRIC_PREFIX = 'agents.ingest'
+
+POLICY_BLOCK = 'block'
+POLICY_DROP_NEWEST = 'drop_newest'
+POLICY_DROP_OLDEST = 'drop_oldest'
+POLICY_SPILL = 'spill'
+OVERFLOW_POLICIES = (POLICY_BLOCK, POLICY_DROP_NEWEST, POLICY_DROP_OLDEST, POLICY_SPILL)
+
+KIND_SNAPSHOT = 'snapshot'
+KIND_LOG = 'log'
+
+# تنظیمات پیش‌فرض؛ settings.AGENT_INGEST و config.params['ingest'] هر عامل آن‌ها را بازنویسی می‌کنند
+DEFAULT_AGENT_INGEST = {
+    'queue_size': 10000,            # ظرفیت صف هر shard
+    'writers': 2,                   # تعداد shard/نخ نویسنده
+    'max_batch_size': 500,
+    'max_latency_ms': 100,          # حداکثر زمان انتظار برای کامل شدن یک batch
+    'overflow_policy': POLICY_BLOCK,
+    'spill_dir': None,              # پیش‌فرض: settings.AGENT_INGEST_SPILL_DIR
+    'max_spill_bytes': 256 * 1024 * 1024,
+    'metrics_flush_seconds': 10,    # فاصله ثبت شمارنده‌های پیام در AgentMetric
+    'close_timeout_seconds': 30,
+}
+
+
+def get_agent_ingest_settings(agent_params: Optional[Dict] = None) -> Dict[str, Any]:
+    """
+    Effective ingest settings: defaults, then settings.AGENT_INGEST, then agent params['ingest'].
+    """
+    merged = dict(DEFAULT_AGENT_INGEST)
+    merged.update(getattr(settings, 'AGENT_INGEST', {}) or {})
+    overrides = (agent_params or {}).get('ingest') or {}
+    if isinstance(overrides, dict):
+        merged.update(overrides)
+    for key in ('queue_size', 'writers', 'max_batch_size', 'max_latency_ms'):
+        merged[key] = max(1, int(merged[key]))
+    if merged['overflow_policy'] not in OVERFLOW_POLICIES:
+        logger.warning(f"Unknown ingest overflow policy {merged['overflow_policy']!r}; using {POLICY_BLOCK!r}.")
+        merged['overflow_policy'] = POLICY_BLOCK
+    if not merged['spill_dir']:
+        merged['spill_dir'] = getattr(settings, 'AGENT_INGEST_SPILL_DIR', os.path.join(settings.BASE_DIR, 'var', 'agent_spill'))
+    return merged
+
+
+def _timestamp_ms(value) -> int:
+    # صرافی‌ها زمان را به ثانیه یا میلی‌ثانیه می‌فرستند
+    value = int(float(value))
+    return value if value >= 10 ** 11 else value * 1000
+
+
+def snapshot_record(config, normalized: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    JSON-safe snapshot row (decimal strings, epoch ms) for the ingest queue.
+    """
+    record = {'config_id': str(config.id), 'timestamp': _timestamp_ms(normalized['timestamp'])}
+    for field in ('open', 'high', 'low', 'close', 'volume', 'best_bid', 'best_ask', 'bid_size', 'ask_size'):
+        value = normalized.get(field)
+        record[field] = str(value) if value not in (None, '') else None
+    record['additional_data'] = normalized.get('additional_data') or {}
+    return record
+
+
+# --- نویسنده‌های batch (در نخ‌های نویسنده اجرا می‌شوند) ---
+
+def write_snapshots(records: List[Dict[str, Any]]) -> int:
+    """
+    Bulk upserts snapshot rows on (config, timestamp), then runs the per-config snapshot
+    post-persist hooks (bulk_create skips the post_save receivers and the service path).
+    """
+    from apps.market_data.models import MarketDataConfig, MarketDataSnapshot # Import داخل تابع برای جلوگیری از حلقه
+    from apps.market_data.services import MarketDataService
+    from apps.market_data.storage import from_epoch_ms
+
+    # به‌روزرسانی‌های پیاپی کندل باز در یک batch به آخرین مقدار خلاصه می‌شوند
+    latest = {}
+    for record in records:
+        latest[(record['config_id'], record['timestamp'])] = record
+    configs = {str(pk): config for pk, config in MarketDataConfig.objects.in_bulk({config_id for config_id, _ in latest}).items()}
+
+    def decimal(value):
+        return Decimal(value) if value is not None else None
+
+    rows = [
+        MarketDataSnapshot(
+            config=configs[record['config_id']],
+            timestamp=from_epoch_ms(record['timestamp']),
+            open_price=decimal(record['open']),
+            high_price=decimal(record['high']),
+            low_price=decimal(record['low']),
+            close_price=decimal(record['close']),
+            volume=decimal(record['volume']),
+            best_bid=decimal(record.get('best_bid')),
+            best_ask=decimal(record.get('best_ask')),
+            bid_size=decimal(record.get('bid_size')),
+            ask_size=decimal(record.get('ask_size')),
+            additional_data=record.get('additional_data') or {},
+        )
+        for record in latest.values()
+        if record['config_id'] in configs
+    ]
+    MarketDataSnapshot.objects.bulk_create(
+        rows,
+        batch_size=1000,
+        update_conflicts=True,
+        unique_fields=['config', 'timestamp'],
+        update_fields=['open_price', 'high_price', 'low_price', 'close_price', 'volume',
+                       'best_bid', 'best_ask', 'bid_size', 'ask_size', 'additional_data'],
+    )
+    # پردازش‌های پس از ذخیره هر سری به ترتیب زمانی (همان مسیر ذخیره تکی و backfill)
+    by_config: Dict[Any, List[Any]] = {}
+    for row in rows:
+        by_config.setdefault(row.config_id, []).append(row)
+    for config_id, config_rows in by_config.items():
+        try:
+            MarketDataService.run_snapshot_hooks(configs[str(config_id)], config_rows)
+        except Exception as e:
+            logger.error(f"Error running snapshot hooks for config {config_id}: {str(e)}")
+    return len(rows)
+
+
+def write_logs(records: List[Dict[str, Any]]) -> int:
+    from .models import AgentLog # Import داخل تابع برای جلوگیری از حلقه
+
+    AgentLog.objects.bulk_create([
+        AgentLog(
+            agent_id=record['agent_id'],
+            level=record['level'],
+            message=record['message'],
+            extra_data=record.get('extra_data') or {},
+        )
+        for record in records
+    ], batch_size=1000)
+    return len(records)
+
+
+def write_message_counts(agent_id, received: int, errors: int, processing_ms: float):
+    """
+    Adds message counters to the agent's AgentMetric row of the current hour.
+    """
+    from .models import AgentMetric # Import داخل تابع برای جلوگیری از حلقه
+
+    period_start = timezone.now().replace(minute=0, second=0, microsecond=0)
+    metric, _ = AgentMetric.objects.get_or_create(
+        agent_id=agent_id,
+        period_start=period_start,
+        defaults={'period_end': period_start + timedelta(hours=1)},
+    )
+    AgentMetric.objects.filter(pk=metric.pk).update(
+        messages_received=F('messages_received') + received,
+        errors_count=F('errors_count') + errors,
+        avg_processing_time_ms=Decimal(f'{processing_ms / received:.3f}') if received else metric.avg_processing_time_ms,
+    )
+
+
+RECORD_WRITERS: Dict[str, Callable[[List[Dict[str, Any]]], int]] = {
+    KIND_SNAPSHOT: write_snapshots,
+    KIND_LOG: write_logs,
+}
+
+
+class SpillStore:
+    """
+    FIFO of records on disk as numbered JSONL segments; one segment is replayed at a time.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._segments = deque(sorted(name for name in os.listdir(directory) if name.endswith('.jsonl')))
+        self._bytes = sum(os.path.getsize(os.path.join(directory, name)) for name in self._segments)
+        self._next = int(self._segments[-1].split('.')[0]) + 1 if self._segments else 0
+
+    def __len__(self):
+        return len(self._segments)
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+    def write(self, items: List[Tuple[str, Dict]]) -> bool:
+        data = ''.join(json.dumps([kind, payload], default=str) + '\n' for kind, payload in items).encode()
+        with self._lock:
+            if self._bytes + len(data) > self.max_bytes:
+                return False
+            name = f'{self._next:012d}.jsonl'
+            self._next += 1
+            with open(os.path.join(self.directory, name), 'wb') as handle:
+                handle.write(data)
+            self._segments.append(name)
+            self._bytes += len(data)
+            return True
+
+    def pop(self) -> List[Tuple[str, Dict]]:
+        with self._lock:
+            if not self._segments:
+                return []
+            path = os.path.join(self.directory, self._segments.popleft())
+            with open(path, 'rb') as handle:
+                data = handle.read()
+            os.remove(path)
+            self._bytes -= len(data)
+        return [tuple(json.loads(line)) for line in data.splitlines() if line]
+
+
+class AgentIngestPipeline:
+    """
+    Bounded queues between an agent's socket readers and batched DB writers.
+    """
+
+    def __init__(self, agent_id, options: Optional[Dict[str, Any]] = None,
+                 writers: Optional[Dict[str, Callable]] = None, metric_writer: Optional[Callable] = None,
+                 clock=time.monotonic):
+        self.agent_id = agent_id
+        self.options = options or get_agent_ingest_settings()
+        self._writers = writers or RECORD_WRITERS
+        self._metric_writer = metric_writer or write_message_counts
+        self._clock = clock
+        self._queues: List[asyncio.Queue] = []
+        self._tasks: List[asyncio.Task] = []
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._spill: Optional[SpillStore] = None
+        self._spill_buffer: List[Tuple[str, Dict]] = []
+        self._spill_lock: Optional[asyncio.Lock] = None
+        self._spill_in_flight = 0  # رکوردهای در حال نوشتن روی دیسک یا بازپخش از آن
+        self._closing = False
+        self._counts = {'received': 0, 'errors': 0, 'processing_ms': 0.0}
+        self.stats = {'enqueued': 0, 'written': 0, 'dropped': 0, 'spilled': 0, 'replayed': 0, 'failed': 0}
+
+    # --- چرخه حیات ---
+
+    async def start(self):
+        shards = self.options['writers']
+        self._queues = [asyncio.Queue(maxsize=self.options['queue_size']) for _ in range(shards)]
+        self._executor = ThreadPoolExecutor(max_workers=shards + 1, thread_name_prefix='agent-ingest')
+        if self.options['overflow_policy'] == POLICY_SPILL:
+            directory = os.path.join(self.options['spill_dir'], f'agent_{self.agent_id}')
+            self._spill = SpillStore(directory, int(self.options['max_spill_bytes']))
+            self._spill_lock = asyncio.Lock()
+        self._tasks = [asyncio.create_task(self._writer_loop(shard)) for shard in range(shards)]
+        self._tasks.append(asyncio.create_task(self._maintenance_loop()))
+
+    async def close(self):
+        """
+        Stops accepting records, drains the queues (spilled records stay on disk) and flushes counters.
+        """
+        self._closing = True
+        if not await self.drain(self.options['close_timeout_seconds']):
+            logger.warning(f"Ingest pipeline of agent {self.agent_id} closed with {self.depth} records unwritten.")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self._flush_counts()
+        self._executor.shutdown(wait=True)
+
+    @property
+    def is_running(self) -> bool:
+        return bool(self._tasks) and not self._closing
+
+    async def drain(self, timeout: Optional[float] = None) -> bool:
+        """
+        Waits until queued records are written (records already spilled to disk stay there); False on timeout.
+        """
+        if self._spill is not None and self._spill_buffer:
+            await self._flush_spill_buffer()
+        try:
+            await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self._queues)), timeout=timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    # --- مرحله ورودی (در حلقه رویداد، بدون ORM) ---
+
+    def _shard(self, kind: str, payload: Dict) -> asyncio.Queue:
+        key = payload.get('config_id') if kind == KIND_SNAPSHOT else kind
+        return self._queues[hash(key) % len(self._queues)]
+
+    @property
+    def depth(self) -> int:
+        return sum(queue.qsize() for queue in self._queues)
+
+    def _spilling(self) -> bool:
+        # تا وقتی رکوردی روی دیسک مانده، رکوردهای جدید هم پشت آن‌ها می‌روند تا ترتیب حفظ شود
+        return self._spill is not None and (bool(self._spill_buffer) or self._spill_in_flight > 0 or len(self._spill) > 0)
+
+    async def submit(self, kind: str, payload: Dict) -> bool:
+        """
+        Queues a record; applies the overflow policy when its shard is full. Returns False if dropped.
+        """
+        if self._spilling():
+            return await self._spill_record(kind, payload)
+        item = (kind, payload, self._clock())
+        queue = self._shard(kind, payload)
+        try:
+            queue.put_nowait(item)
+        except asyncio.QueueFull:
+            policy = self.options['overflow_policy']
+            if policy == POLICY_SPILL:
+                return await self._spill_record(kind, payload)
+            if policy != POLICY_BLOCK:
+                return self._overflow(queue, kind, payload, item)
+            started = self._clock()
+            await queue.put(item)
+            metrics.observe(f'{METRIC_PREFIX}.enqueue_wait_ms', (self._clock() - started) * 1000)
+        self.stats['enqueued'] += 1
+        return True
+
+    def offer(self, kind: str, payload: Dict) -> bool:
+        """
+        Non-blocking submit for callers that cannot await; a full shard never blocks (block acts as drop_newest).
+        """
+        if not self.is_running:
+            return False
+        if self._spilling():
+            return self._to_spill(kind, payload)
+        item = (kind, payload, self._clock())
+        queue = self._shard(kind, payload)
+        try:
+            queue.put_nowait(item)
+        except asyncio.QueueFull:
+            return self._overflow(queue, kind, payload, item)
+        self.stats['enqueued'] += 1
+        return True
+
+    def _overflow(self, queue: asyncio.Queue, kind: str, payload: Dict, item) -> bool:
+        policy = self.options['overflow_policy']
+        if policy == POLICY_SPILL:
+            return self._to_spill(kind, payload)
+        if policy == POLICY_DROP_OLDEST:
+            queue.get_nowait()
+            queue.task_done()
+            queue.put_nowait(item)
+            self._dropped()
+            self.stats['enqueued'] += 1
+            return True
+        self._dropped()
+        return False
+
+    def _dropped(self):
+        self.stats['dropped'] += 1
+        metrics.incr(f'{METRIC_PREFIX}.dropped')
+
+    async def _spill_record(self, kind: str, payload: Dict) -> bool:
+        stored = self._to_spill(kind, payload)
+        if len(self._spill_buffer) >= self.options['max_batch_size']:
+            # نوشتن segment در نخ نویسنده انجام می‌شود و ورودی تا پایان آن منتظر می‌ماند
+            await self._flush_spill_buffer()
+        return stored
+
+    def _to_spill(self, kind: str, payload: Dict) -> bool:
+        # بافر حافظه محدود است؛ offer() که نمی‌تواند منتظر بماند پس از آن رکورد را حذف می‌کند
+        if len(self._spill_buffer) >= 2 * self.options['max_batch_size']:
+            self._dropped()
+            return False
+        self._spill_buffer.append((kind, payload))
+        self.stats['spilled'] += 1
+        metrics.incr(f'{METRIC_PREFIX}.spilled')
+        return True
+
+    def count_message(self, processing_ms: float = 0.0, error: bool = False):
+        """
+        Counts a handled message; counters are written to AgentMetric periodically, not per message.
+        """
+        self._counts['received'] += 1
+        self._counts['processing_ms'] += processing_ms
+        if error:
+            self._counts['errors'] += 1
+        metrics.observe(f'{METRIC_PREFIX}.handle_ms', processing_ms)
+
+    # --- مرحله نویسنده ---
+
+    async def _next_batch(self, queue: asyncio.Queue) -> List:
+        batch = [await queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.options['max_latency_ms'] / 1000.0
+        while len(batch) < self.options['max_batch_size']:
+            try:
+                batch.append(queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _writer_loop(self, shard: int):
+        queue = self._queues[shard]
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch(queue)
+            metrics.observe(f'{METRIC_PREFIX}.queue_latency_ms', (self._clock() - batch[0][2]) * 1000)
+            metrics.observe(f'{METRIC_PREFIX}.batch_size', len(batch))
+            started = self._clock()
+            try:
+                written, failed = await loop.run_in_executor(self._executor, self._write_batch, batch)
+                self.stats['written'] += written
+                self.stats['failed'] += failed
+            except Exception as e:
+                self.stats['failed'] += len(batch)
+                logger.error(f"Ingest batch of agent {self.agent_id} failed: {e}")
+            finally:
+                for _ in batch:
+                    queue.task_done()
+            metrics.observe(f'{METRIC_PREFIX}.write_ms', (self._clock() - started) * 1000)
+            metrics.gauge(f'{METRIC_PREFIX}.queue_depth', self.depth)
+
+    def _write_batch(self, batch: List) -> Tuple[int, int]:
+        grouped: Dict[str, List[Dict]] = {}
+        for kind, payload, _ in batch:
+            grouped.setdefault(kind, []).append(payload)
+        written = failed = 0
+        close_old_connections()
+        try:
+            for kind, payloads in grouped.items():
+                writer = self._writers.get(kind)
+                try:
+                    if writer is None:
+                        raise ValueError(f"no writer for record kind {kind!r}")
+                    written += writer(payloads)
+                    metrics.incr(f'{METRIC_PREFIX}.written.{kind}', len(payloads))
+                except Exception as e:
+                    failed += len(payloads)
+                    metrics.incr(f'{METRIC_PREFIX}.write_errors')
+                    logger.error(f"Ingest writer failed for {len(payloads)} {kind} records of agent {self.agent_id}: {e}")
+        finally:
+            close_old_connections()
+        return written, failed
+
+    # --- نگهداری: spill و شمارنده‌ها ---
+
+    async def _flush_spill_buffer(self):
+        # قفل ترتیب segmentها را حفظ می‌کند
+        async with self._spill_lock:
+            items, self._spill_buffer = self._spill_buffer, []
+            if not items:
+                return
+            self._spill_in_flight += len(items)
+            try:
+                stored = await asyncio.get_running_loop().run_in_executor(self._executor, self._spill.write, items)
+            finally:
+                self._spill_in_flight -= len(items)
+            if not stored:
+                self.stats['dropped'] += len(items)
+                metrics.incr(f'{METRIC_PREFIX}.dropped', len(items))
+                logger.error(f"Spill of agent {self.agent_id} is full; dropped {len(items)} records.")
+
+    async def _replay_spill(self):
+        self._spill_in_flight += 1
+        try:
+            items = await asyncio.get_running_loop().run_in_executor(self._executor, self._spill.pop)
+            for kind, payload in items:
+                item = (kind, payload, self._clock())
+                queue = self._shard(kind, payload)
+                if queue.full():
+                    await queue.put(item)
+                else:
+                    queue.put_nowait(item)
+        finally:
+            self._spill_in_flight -= 1
+        self.stats['replayed'] += len(items)
+
+    async def _flush_counts(self):
+        counts, self._counts = self._counts, {'received': 0, 'errors': 0, 'processing_ms': 0.0}
+        if not counts['received'] and not counts['errors']:
+            return
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                self._executor, self._write_counts, counts['received'], counts['errors'], counts['processing_ms'],
+            )
+        except Exception as e:
+            logger.error(f"Error writing message counters of agent {self.agent_id}: {e}")
+
+    def _write_counts(self, received: int, errors: int, processing_ms: float):
+        close_old_connections()
+        try:
+            self._metric_writer(self.agent_id, received, errors, processing_ms)
+        finally:
+            close_old_connections()
+
+    async def _maintenance_loop(self):
+        interval = self.options['max_latency_ms'] / 1000.0
+        last_counts_flush = self._clock()
+        low_watermark = self.options['queue_size'] // 2
+        while True:
+            await asyncio.sleep(interval)
+            if self._spill is not None:
+                if self._spill_buffer:
+                    await self._flush_spill_buffer()
+                if len(self._spill) and max(queue.qsize() for queue in self._queues) < low_watermark:
+                    await self._replay_spill()
+                metrics.gauge(f'{METRIC_PREFIX}.spill_bytes', self._spill.size_bytes)
+            metrics.gauge(f'{METRIC_PREFIX}.queue_depth', self.depth)
+            if self._clock() - last_counts_flush >= self.options['metrics_flush_seconds']:
+                last_counts_flush = self._clock()
+                await self._flush_counts()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            'queue_depth': self.depth,
+            'shard_depths': [queue.qsize() for queue in self._queues],
+            'spill_segments': len(self._spill) if self._spill is not None else 0,
+            'spill_buffer': len(self._spill_buffer),
+        }
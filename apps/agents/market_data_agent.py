@@ -3,16 +3,16 @@ import asyncio
 import json
 import logging
 import ssl
-import websockets
+import time
 import aiohttp
-from decimal import Decimal
-from datetime import datetime
-from django.utils import timezone
-from apps.agents.models import Agent, AgentStatus, AgentMessage, AgentLog, AgentMetric
-from apps.market_data.models import DataSource, MarketDataConfig, MarketDataSnapshot
+from concurrent.futures import ThreadPoolExecutor
+from channels.db import database_sync_to_async
+from apps.agents.models import Agent, AgentStatus, AgentMessage
+from apps.market_data.models import DataSource, MarketDataConfig
 from apps.instruments.models import Instrument
 from apps.connectors.models import APICredential
 from apps.core.messaging import MessageBus  # فرض بر این است که این کلاس وجود دارد
+from .ingest import KIND_LOG, KIND_SNAPSHOT, AgentIngestPipeline, get_agent_ingest_settings, snapshot_record
 
 logger = logging.getLogger(__name__)
 
@@ -22,7 +22,7 @@ class MarketDataAgent:
     عامل جمع‌آوری داده بازار.
     - اتصال به WebSocket یا REST API صرافی‌ها
     - دریافت داده OHLCV، OrderBook، Ticks
-    - ذخیره در دیتابیس (PostgreSQL یا MongoDB)
+    - ذخیره در دیتابیس از طریق صف و نویسنده‌های batch (بدون فراخوانی ORM در حلقه رویداد)
     - ارسال به سایر عامل‌ها از طریق MessageBus
     - مدیریت اشتراک‌ها، محدودیت نرخ، خطاهای اتصال
     """
@@ -35,9 +35,12 @@ class MarketDataAgent:
         self.status = self.agent_model.status
         self.is_running = False
         self.message_bus = MessageBus()
-        self.active_websockets = {}  # {config_id: websocket_connection}
+        self.stream_manager = None  # MarketDataStreamManager (اتصال‌های مشترک هر DataSource)
         self.subscriptions = set()  # {(instrument_id, source_id, timeframe, data_type)}
         self.rate_limit_buckets = {}  # {source_id: {'count': int, 'reset_time': datetime}}
+        self.ingest = AgentIngestPipeline(self.agent_model.id, get_agent_ingest_settings(self.config))
+        self._depth_executor = None  # یک نخ؛ ترتیب diffهای دفتر سفارش حفظ می‌شود
+        self.normalizers = {}  # {config_id: MessageNormalizer}؛ یک بار هنگام اشتراک انتخاب می‌شود
 
     def start(self):
         """
@@ -58,165 +61,137 @@ class MarketDataAgent:
         self.is_running = False
         self.status.state = "STOPPED"
         self.status.save()
-        # بستن تمام اتصالات WebSocket
-        for ws in self.active_websockets.values():
-            if not ws.closed:
-                ws.close()
+        # اتصالات WebSocket در پایان _run_loop توسط stream_manager بسته می‌شوند
 
     async def _run_loop(self):
         """
-        حلقه اصلی عامل: بارگذاری کانفیگ، اتصال، دریافت داده، پردازش و ذخیره.
+        حلقه اصلی عامل: بارگذاری کانفیگ‌ها و همگام‌سازی اشتراک‌ها روی اتصال‌های مشترک.
+        کانفیگ‌های اضافه/حذف‌شده در هر دور بدون راه‌اندازی مجدد عامل اعمال می‌شوند.
         """
-        # 1. بارگذاری تمام کانفیگ‌های فعال
-        configs = MarketDataConfig.objects.filter(
-            is_active=True,
+        from apps.market_data.streams import MarketDataStreamManager, get_stream_sync_interval
+
+        self.stream_manager = MarketDataStreamManager(handler=self._process_message)
+        self._depth_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='order-book')
+        await self.ingest.start()
+        try:
+            while self.is_running:
+                # 1. بارگذاری تمام کانفیگ‌های فعال
+                configs = await database_sync_to_async(self._load_realtime_configs)()
+                self.subscriptions = {
+                    (config.instrument_id, config.data_source_id, config.timeframe, config.data_type)
+                    for config in configs
+                }
+                self.normalizers = {config.id: self._resolve_normalizer(config) for config in configs}
+                # 2. کانفیگ‌های WebSocket روی اتصال‌های چندگانه هر DataSource بسته‌بندی می‌شوند
+                changes = await self.stream_manager.sync(
+                    config for config in configs if config.data_source.type == 'WEBSOCKET'
+                )
+                if changes['added'] or changes['removed']:
+                    logger.info(f"Stream subscriptions updated: {changes}, {self.stream_manager.get_stats()}")
+                await asyncio.sleep(get_stream_sync_interval())
+        finally:
+            await self.stream_manager.close()
+            await self.ingest.close()
+            self._depth_executor.shutdown(wait=True)
+            logger.info(f"MarketDataAgent {self.agent_model.name} ingest stats: {self.ingest.get_stats()}")
+
+    @staticmethod
+    def _load_realtime_configs():
+        return list(MarketDataConfig.objects.filter(
+            data_source__is_active=True,
             is_realtime=True  # فقط داده‌های لحظه‌ای
-        ).select_related('instrument', 'data_source', 'api_credential')
-
-        for config in configs:
-            self.subscriptions.add((
-                config.instrument_id,
-                config.data_source_id,
-                config.timeframe,
-                config.data_type
-            ))
-            if config.data_source.type == 'WEBSOCKET':
-                # 2. برای کانکتورهای WebSocket، یک تسک ایجاد کن
-                asyncio.create_task(self._run_websocket_stream(config))
-
-    async def _run_websocket_stream(self, config: MarketDataConfig):
+        ).select_related('instrument', 'data_source'))
+
+    def _resolve_normalizer(self, config: MarketDataConfig):
         """
-        اتصال به WebSocket یک منبع داده و شروع دریافت داده.
+        نرمالایزر یک کانفیگ (منبع + نوع داده)؛ برای کانفیگ‌های موجود از کش خوانده می‌شود.
         """
-        # پیدا کردن کلاس کانکتور از طریق registry
-        from apps.connectors.registry import get_connector
-        connector_class = get_connector(config.data_source.code.upper())  # مثلاً 'BINANCE'
-        if not connector_class:
-            logger.error(f"No connector found for source: {config.data_source.code}")
-            self._log_agent_message(f"No connector found for {config.data_source.code}", level="ERROR")
-            return
+        from apps.market_data.normalizers import resolve_normalizer
 
-        credential = config.api_credential
-        api_key = credential.api_key_encrypted if credential else ""
-        api_secret = credential.api_secret_encrypted if credential else ""
-
-        connector = connector_class(
-            api_key=api_key,
-            api_secret=api_secret,
-            config=config,
-            agent=self
-        )
-
-        while self.is_running:
-            try:
-                await connector.connect()
-                logger.info(f"Connected to {config.data_source.code} for {config.instrument.symbol}")
-                # اشتراک در کانال مربوطه
-                await connector.subscribe_to_instrument(config.instrument.symbol, config.timeframe)
-                async for message in connector.listen():
-                    await self._process_message(message, config)
-
-            except websockets.exceptions.ConnectionClosed:
-                logger.warning(f"WebSocket to {config.data_source.code} closed. Reconnecting...")
-                await asyncio.sleep(5)  # exponential backoff
-            except Exception as e:
-                logger.error(f"Error in WebSocket stream for {config}: {e}")
-                self._log_agent_message(str(e), level="ERROR")
-                await asyncio.sleep(10)
+        if config.id in self.normalizers:
+            return self.normalizers[config.id]
+        normalizer = resolve_normalizer(config)
+        if normalizer is None and config.data_type != 'ORDER_BOOK':
+            logger.warning(f"No normalizer for {config.data_source.name}/{config.data_type}; messages of {config} are skipped.")
+        return normalizer
 
     async def _process_message(self, raw_data: dict, config: MarketDataConfig):
         """
-        پردازش یک پیام دریافتی از WebSocket و ذخیره در دیتابیس.
+        پردازش یک پیام دریافتی از WebSocket: نرمالایز، قرار دادن در صف ذخیره و ارسال روی MessageBus.
         """
+        started = time.perf_counter()
+        if config.data_type == 'ORDER_BOOK':
+            # دفتر سفارش به صورت محلی با diffها نگهداری می‌شود؛ snapshot/REST آن خارج از حلقه رویداد اجرا می‌شود
+            error = await asyncio.get_running_loop().run_in_executor(self._depth_executor, self._process_depth_event, raw_data, config)
+            self.ingest.count_message((time.perf_counter() - started) * 1000, error=error is not None)
+            if error is not None:
+                self._log_agent_message(f"Error processing depth event: {error}", level="ERROR")
+            return
         try:
-            # 1. نرمالایز کردن داده (تبدیل به فرمت یکنواخت)
-            normalized_data = self._normalize_data(raw_data, config.data_source.code, config.data_type)
-
-            # 2. ذخیره در دیتابیس
-            snapshot = MarketDataSnapshot.objects.create(
-                config=config,
-                timestamp=timezone.make_aware(datetime.fromtimestamp(normalized_data['timestamp'])),
-                open_price=Decimal(str(normalized_data['open'])),
-                high_price=Decimal(str(normalized_data['high'])),
-                low_price=Decimal(str(normalized_data['low'])),
-                close_price=Decimal(str(normalized_data['close'])),
-                volume=Decimal(str(normalized_data['volume'])),
-                best_bid=Decimal(str(normalized_data.get('best_bid', 0))),
-                best_ask=Decimal(str(normalized_data.get('best_ask', 0))),
-                bid_size=Decimal(str(normalized_data.get('bid_size', 0))),
-                ask_size=Decimal(str(normalized_data.get('ask_size', 0))),
-                additional_data=normalized_data.get('additional_data', {})
-            )
-            logger.info(f"Stored snapshot for {config.instrument.symbol} at {snapshot.timestamp}")
+            # 1. نرمالایز کردن داده با نرمالایزر از پیش انتخاب‌شده
+            normalizer = self.normalizers.get(config.id)
+            if normalizer is None:
+                return
+            normalized_data = normalizer.normalize(raw_data)
+            if normalized_data is None:
+                return  # پیام بدون داده (مثلاً تأیید اشتراک)
+            record = snapshot_record(config, normalized_data)
+
+            # 2. قرار دادن در صف ذخیره (نویسنده‌های batch آن را در نخ جداگانه ذخیره می‌کنند)
+            await self.ingest.submit(KIND_SNAPSHOT, record)
 
             # 3. ارسال داده به سایر عامل‌ها (مثل StrategyAgent) از طریق MessageBus
             topic = f"market.{config.instrument.symbol}.{config.timeframe}"
             payload = {
-                "instrument_id": config.instrument.id,
+                "instrument_id": str(config.instrument_id),
                 "symbol": config.instrument.symbol,
-                "timestamp": snapshot.timestamp.isoformat(),
-                "open": float(snapshot.open_price),
-                "high": float(snapshot.high_price),
-                "low": float(snapshot.low_price),
-                "close": float(snapshot.close_price),
-                "volume": float(snapshot.volume),
-                "source": config.data_source.code,
+                "timestamp": record['timestamp'],
+                "open": float(record['open']),
+                "high": float(record['high']),
+                "low": float(record['low']),
+                "close": float(record['close']),
+                "volume": float(record['volume']),
+                "source": normalizer.code,
             }
             await self.message_bus.publish(topic, payload)
 
-            # 4. به‌روزرسانی متریک‌ها
-            self._update_metrics(config.instrument.symbol)
+            # 4. به‌روزرسانی متریک‌ها (شمارنده‌ها دوره‌ای در AgentMetric ثبت می‌شوند)
+            self.ingest.count_message((time.perf_counter() - started) * 1000)
 
         except Exception as e:
             logger.error(f"Error processing message for {config}: {e}")
+            self.ingest.count_message((time.perf_counter() - started) * 1000, error=True)
             self._log_agent_message(f"Error processing message: {e}", level="ERROR")
 
-    def _normalize_data(self, raw_data: dict, source_code: str, data_type: str) -> dict:
+    def _process_depth_event(self, raw_data: dict, config: MarketDataConfig):
         """
-        تبدیل داده خام از هر صرافی به یک فرمت یکنواخت.
+        اعمال یک پیام depth (snapshot یا diff) روی دفتر سفارش محلی.
+        در نخ دفتر سفارش اجرا می‌شود؛ خطا برگردانده می‌شود تا در حلقه رویداد لاگ شود.
         """
-        # مثال ساده برای OHLCV
-        if data_type == 'OHLCV':
-            if source_code.upper() == 'BINANCE':
-                return {
-                    "timestamp": raw_data['k']['T'],
-                    "open": raw_data['k']['o'],
-                    "high": raw_data['k']['h'],
-                    "low": raw_data['k']['l'],
-                    "close": raw_data['k']['c'],
-                    "volume": raw_data['k']['v'],
-                    "best_bid": raw_data.get('b', 0),
-                    "best_ask": raw_data.get('a', 0),
-                }
-            elif source_code.upper() == 'NOBITEX':
-                # منطق نرمالایز Nobitex
-                return {
-                    "timestamp": raw_data['timestamp'],
-                    "open": raw_data['open'],
-                    "high": raw_data['high'],
-                    "low": raw_data['low'],
-                    "close": raw_data['close'],
-                    "volume": raw_data['volume'],
-                }
-            # سایر صرافی‌ها...
-        return raw_data
+        from apps.market_data.order_book import order_book_engine
+        from apps.market_data.streams import get_source_code, get_stream_protocol
+
+        try:
+            protocol = get_stream_protocol(get_source_code(config.data_source))
+            event = protocol.parse_depth_event(raw_data) if protocol else None
+            if event is None:
+                return None
+            if event['type'] == 'diff':
+                order_book_engine.on_diff(config, event)
+            else:
+                order_book_engine.on_snapshot(config, event)
+        except Exception as e:
+            logger.error(f"Error processing depth event for {config}: {e}")
+            return str(e)
+        return None
 
     def _log_agent_message(self, message: str, level: str = "INFO"):
-        AgentLog.objects.create(
-            agent=self.agent_model,
-            level=level,
-            message=message,
-            extra_data={"source": "MarketDataAgent"},
-        )
-
-    def _update_metrics(self, symbol: str):
-        # مثلاً افزایش تعداد پیام دریافتی
-        # باید یک مدل AgentMetric داشته باشید
-        from django.utils import timezone
-        AgentMetric.objects.update_or_create(
-            agent=self.agent_model,
-            period_start=timezone.now().replace(minute=0, second=0, microsecond=0),
-            defaults={
-                'messages_received': models.F('messages_received') + 1
-            }
-        )
\ No newline at end of file
+        # لاگ از طریق صف ذخیره می‌شود؛ اگر صف فعال نباشد یا پر باشد فقط در logger می‌ماند
+        queued = self.ingest.offer(KIND_LOG, {
+            "agent_id": str(self.agent_model.id),
+            "level": level,
+            "message": message,
+            "extra_data": {"source": "MarketDataAgent"},
+        })
+        if not queued:
+            logger.warning(f"Agent log not persisted ({level}): {message}")
@@ -3,6 +3,7 @@ from rest_framework import viewsets, permissions
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework import status
+from django_filters.rest_framework import DjangoFilterBackend
 from .models import (
     AgentType, Agent, AgentInstance, AgentConfig, AgentStatus, AgentMessage, AgentLog, AgentMetric
 )
@@ -40,6 +41,9 @@ class AgentMessageViewSet(viewsets.ModelViewSet):  # بدون owner
     queryset = AgentMessage.objects.all()
     serializer_class = AgentMessageSerializer
     permission_classes = [permissions.IsAuthenticated]
+    # ردیابی زنجیره پیام‌ها با ?correlation_id=... (ایندکس‌شده)
+    filter_backends = [DjangoFilterBackend]
+    filterset_fields = ['correlation_id', 'topic', 'message_type', 'processed']
 
 class AgentLogViewSet(viewsets.ModelViewSet):  # بدون owner
     queryset = AgentLog.objects.all()
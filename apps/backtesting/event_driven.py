@@ -0,0 +1,606 @@
+# apps/backtesting/event_driven.py
+
+"""
+Event-driven backtest engine for path-dependent strategies.
+
+Tick and order-book history is streamed chunk by chunk from a ReplayDataset and merged
+through a priority queue together with simulated order arrivals (latency). A matching
+simulator fills market orders against visible depth and rests limit orders with a
+queue-ahead estimate, so fills can be partial. Bars of the run timeframe are built from
+ticks; the strategy's indicators are updated incrementally on bar close and evaluated
+with the same condition format as the vectorized engine. Stop-loss and trailing stops
+(RiskProfile.trailing_stop_config) are checked on every trade tick.
+"""
+
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from apps.instruments.exceptions import IndicatorValidationError
+from apps.instruments.indicator_engine import get_indicator_class
+from apps.market_data.resampling import timeframe_to_ms
+from apps.market_data.storage import OHLCVArrays
+from .exceptions import BacktestConfigurationError
+from .replay import ReplayDataset, TICK_SIDE_BUY, TICK_SIDE_SELL
+from .vectorized import (
+    _PRICE_ACTION_CALCULATORS,
+    DIRECTION_LONG,
+    DIRECTION_SHORT,
+    EXIT_REASON_END_OF_DATA,
+    EXIT_REASON_SIGNAL,
+    BacktestOutcome,
+    evaluate_conditions,
+    get_cost_settings,
+    resolve_parameters,
+    summarize,
+    trade_notional,
+)
+
+logger = logging.getLogger(__name__)
+
+EPSILON = 1e-12
+
+# ترتیب رویدادهای هم‌زمان: ابتدا دفتر سفارش، سپس ورود سفارش، سپس معامله
+PRIORITY_BOOK = 0
+PRIORITY_ORDER = 1
+PRIORITY_TICK = 2
+
+ORDER_MARKET = 'MARKET'
+ORDER_LIMIT = 'LIMIT'
+
+STATUS_OPEN = 'OPEN'
+STATUS_FILLED = 'FILLED'
+STATUS_CANCELLED = 'CANCELLED'
+
+EXIT_REASON_STOP_LOSS = 'stop_loss'
+EXIT_REASON_TRAILING_STOP = 'trailing_stop'
+ENTRY_REASON = 'entry'
+
+
+# --- رویدادها (اشیای فشرده با __slots__) ---
+
+class TickEvent:
+    __slots__ = ('timestamp', 'price', 'quantity', 'side')
+
+    def __init__(self, timestamp: int, price: float, quantity: float, side: int):
+        self.timestamp = timestamp
+        self.price = price
+        self.quantity = quantity
+        self.side = side
+
+
+class BookEvent:
+    __slots__ = ('timestamp', 'bids', 'asks')
+
+    def __init__(self, timestamp: int, bids: List[List[float]], asks: List[List[float]]):
+        self.timestamp = timestamp
+        self.bids = bids
+        self.asks = asks
+
+
+class OrderEvent:
+    __slots__ = ('timestamp', 'order')
+
+    def __init__(self, timestamp: int, order: 'SimOrder'):
+        self.timestamp = timestamp
+        self.order = order
+
+
+class SimOrder:
+    __slots__ = ('order_id', 'side', 'quantity', 'order_type', 'limit_price', 'filled', 'queue_ahead',
+                 'status', 'reason', 'created_bar', 'fill_count')
+
+    def __init__(self, order_id: str, side: str, quantity: float, order_type: str = ORDER_MARKET,
+                 limit_price: Optional[float] = None, reason: str = ENTRY_REASON, created_bar: int = 0):
+        self.order_id = order_id
+        self.side = side
+        self.quantity = quantity
+        self.order_type = order_type
+        self.limit_price = limit_price
+        self.filled = 0.0
+        self.queue_ahead = 0.0
+        self.status = STATUS_OPEN
+        self.reason = reason
+        self.created_bar = created_bar
+        self.fill_count = 0
+
+    @property
+    def remaining(self) -> float:
+        return self.quantity - self.filled
+
+    @property
+    def is_active(self) -> bool:
+        return self.status == STATUS_OPEN
+
+
+class Fill:
+    __slots__ = ('order_id', 'side', 'price', 'quantity', 'fee', 'timestamp', 'pnl', 'reason', 'trade_no', 'opening')
+
+    def __init__(self, order_id: str, side: str, price: float, quantity: float, fee: float, timestamp: int, reason: str):
+        self.order_id = order_id
+        self.side = side
+        self.price = price
+        self.quantity = quantity
+        self.fee = fee
+        self.timestamp = timestamp
+        self.reason = reason
+        self.pnl = 0.0
+        self.trade_no = 0
+        self.opening = False
+
+
+# --- خواندن جریانی تاریخچه ---
+
+def iter_tick_events(dataset: ReplayDataset):
+    for chunk in dataset.iter_tick_chunks():
+        columns = zip(chunk['timestamp'].tolist(), chunk['price'].tolist(), chunk['quantity'].tolist(), chunk['side'].tolist())
+        for timestamp, price, quantity, side in columns:
+            yield TickEvent(timestamp, price, quantity, side)
+
+
+def iter_book_events(dataset: ReplayDataset):
+    for chunk in dataset.iter_book_chunks():
+        timestamps = chunk['timestamp'].tolist()
+        bid_prices, bid_qtys = chunk['bid_price'].tolist(), chunk['bid_qty'].tolist()
+        ask_prices, ask_qtys = chunk['ask_price'].tolist(), chunk['ask_qty'].tolist()
+        for i, timestamp in enumerate(timestamps):
+            yield BookEvent(
+                timestamp,
+                [[p, q] for p, q in zip(bid_prices[i], bid_qtys[i]) if q > 0],
+                [[p, q] for p, q in zip(ask_prices[i], ask_qtys[i]) if q > 0],
+            )
+
+
+# --- شبیه‌ساز تطبیق ---
+
+class MatchingSimulator:
+    """
+    Fills orders against the latest book snapshot (consuming depth) and trade ticks
+    (consuming the queue ahead of resting limit orders).
+    """
+
+    def __init__(self, commission: float = 0.0, slippage: float = 0.0):
+        self.commission = commission
+        self.slippage = slippage
+        self.bids: List[List[float]] = []
+        self.asks: List[List[float]] = []
+        self.last_price: Optional[float] = None
+        self.resting: List[SimOrder] = []
+
+    def _fill(self, order: SimOrder, price: float, quantity: float, timestamp: int) -> Fill:
+        order.filled += quantity
+        order.fill_count += 1
+        if order.remaining <= EPSILON:
+            order.status = STATUS_FILLED
+        return Fill(order.order_id, order.side, price, quantity, self.commission * price * quantity, timestamp, order.reason)
+
+    def _level_qty(self, order: SimOrder) -> Optional[float]:
+        for price, quantity in (self.bids if order.side == 'BUY' else self.asks):
+            if price == order.limit_price:
+                return quantity
+        return None
+
+    def _take(self, order: SimOrder, timestamp: int, limit: Optional[float]) -> List[Fill]:
+        """
+        Consumes opposite-side depth up to `limit` (or without limit for market orders).
+        Consumed depth stays removed until the next book snapshot.
+        """
+        fills = []
+        levels = self.asks if order.side == 'BUY' else self.bids
+        while order.remaining > EPSILON and levels:
+            price, available = levels[0]
+            if limit is not None and (price > limit if order.side == 'BUY' else price < limit):
+                break
+            quantity = min(order.remaining, available)
+            fills.append(self._fill(order, price, quantity, timestamp))
+            levels[0][1] -= quantity
+            if levels[0][1] <= EPSILON:
+                levels.pop(0)
+        return fills
+
+    def _prune(self):
+        self.resting = [order for order in self.resting if order.is_active]
+
+    def submit(self, order: SimOrder, timestamp: int) -> List[Fill]:
+        if order.order_type == ORDER_MARKET:
+            fills = self._take(order, timestamp, None)
+            if order.remaining > EPSILON and not (self.asks if order.side == 'BUY' else self.bids) and self.last_price is not None and not fills:
+                # بدون دفتر سفارش: پر شدن کامل با آخرین قیمت و لغزش
+                direction = 1 if order.side == 'BUY' else -1
+                fills.append(self._fill(order, self.last_price * (1 + direction * self.slippage), order.remaining, timestamp))
+        else:
+            fills = self._take(order, timestamp, order.limit_price)
+            if order.is_active:
+                order.queue_ahead = self._level_qty(order) or 0.0
+        if order.is_active:
+            self.resting.append(order)
+        return fills
+
+    def cancel(self, order: SimOrder):
+        if order.is_active:
+            order.status = STATUS_CANCELLED
+        self._prune()
+
+    def on_book(self, event: BookEvent) -> List[Fill]:
+        self.bids, self.asks = event.bids, event.asks
+        fills = []
+        for order in self.resting:
+            if order.order_type == ORDER_LIMIT:
+                level_qty = self._level_qty(order)
+                if level_qty is not None:
+                    # لغو سفارش‌های جلوتر در صف، موقعیت ما را بهبود می‌دهد
+                    order.queue_ahead = min(order.queue_ahead, level_qty)
+            fills.extend(self._take(order, event.timestamp, order.limit_price))
+        self._prune()
+        return fills
+
+    def on_trade(self, tick: TickEvent) -> List[Fill]:
+        self.last_price = tick.price
+        if not self.resting:
+            return []
+        fills = []
+        available = tick.quantity
+        for order in self.resting:
+            if available <= EPSILON:
+                break
+            if order.order_type == ORDER_MARKET:
+                direction = 1 if order.side == 'BUY' else -1
+                quantity = min(order.remaining, available)
+                available -= quantity
+                fills.append(self._fill(order, tick.price * (1 + direction * self.slippage), quantity, tick.timestamp))
+                continue
+            if order.side == 'BUY':
+                if tick.side == TICK_SIDE_BUY or tick.price > order.limit_price:
+                    continue
+            elif tick.side == TICK_SIDE_SELL or tick.price < order.limit_price:
+                continue
+            if tick.price == order.limit_price:
+                consumed = min(order.queue_ahead, available)
+                order.queue_ahead -= consumed
+                available -= consumed
+                if available <= EPSILON:
+                    continue
+            quantity = min(order.remaining, available)
+            available -= quantity
+            fills.append(self._fill(order, order.limit_price, quantity, tick.timestamp))
+        self._prune()
+        return fills
+
+
+# --- حساب معاملاتی ---
+
+class Portfolio:
+    """
+    Cash, signed position and average entry price; assigns round-trip numbers to fills.
+    """
+
+    def __init__(self, initial_capital: float):
+        self.cash = float(initial_capital)
+        self.position = 0.0
+        self.avg_price = 0.0
+        self.trade_no = 0
+
+    def equity(self, price: Optional[float]) -> float:
+        return self.cash + (self.position * price if price is not None else 0.0)
+
+    def apply(self, fill: Fill):
+        signed = fill.quantity if fill.side == 'BUY' else -fill.quantity
+        self.cash -= signed * fill.price + fill.fee
+        realized = 0.0
+        if abs(self.position) <= EPSILON:
+            self.trade_no += 1
+            self.position = 0.0
+        if self.position == 0.0 or (self.position > 0) == (signed > 0):
+            size = abs(self.position)
+            self.avg_price = (self.avg_price * size + fill.price * fill.quantity) / (size + fill.quantity)
+            self.position += signed
+            fill.opening = True
+        else:
+            closing = min(fill.quantity, abs(self.position))
+            realized = closing * (fill.price - self.avg_price) * (1 if self.position > 0 else -1)
+            self.position += signed
+            if abs(self.position) <= EPSILON:
+                self.position, self.avg_price = 0.0, 0.0
+        fill.trade_no = self.trade_no
+        fill.pnl = realized - fill.fee
+
+
+# --- موتور ---
+
+class EventDrivenBacktester:
+    """
+    Replays a ReplayDataset through a priority-queue event loop and returns a BacktestOutcome
+    (with per-fill records in `fills`).
+    """
+
+    def __init__(self, dataset: ReplayDataset, timeframe: str, indicator_configs: Optional[List[Dict]] = None,
+                 price_action_configs: Optional[List[Dict]] = None, run_parameters: Optional[Dict[str, Any]] = None,
+                 runtime_config: Optional[Dict[str, Any]] = None, initial_capital: float = 10_000.0,
+                 position_size_mode: str = 'percent', position_size_value: float = 100.0,
+                 trailing_stop_config: Optional[Dict[str, Any]] = None):
+        self.dataset = dataset
+        self.timeframe = timeframe
+        self.bar_ms = timeframe_to_ms(timeframe)
+        self.run_parameters = run_parameters or {}
+        runtime_config = runtime_config or {}
+        self.initial_capital = float(initial_capital)
+        self.position_size_mode = position_size_mode
+        self.position_size_value = float(position_size_value)
+
+        direction = str(self.run_parameters.get('direction', DIRECTION_LONG)).lower()
+        if direction not in (DIRECTION_LONG, DIRECTION_SHORT):
+            raise BacktestConfigurationError(f"Unsupported direction '{direction}'.")
+        self.entry_side, self.exit_side = ('SELL', 'BUY') if direction == DIRECTION_SHORT else ('BUY', 'SELL')
+        self.sign = -1 if direction == DIRECTION_SHORT else 1
+
+        costs = get_cost_settings(runtime_config)
+        self.matcher = MatchingSimulator(costs['commission'], costs['slippage'])
+        self.portfolio = Portfolio(self.initial_capital)
+        self.order_type = str(runtime_config.get('order_type', ORDER_MARKET)).upper()
+        if self.order_type not in (ORDER_MARKET, ORDER_LIMIT):
+            raise BacktestConfigurationError(f"Unsupported order type '{self.order_type}'.")
+        self.limit_offset = float(runtime_config.get('limit_offset_bps', 0)) / 10_000
+        self.latency_ms = int(runtime_config.get('latency_ms', 0))
+        self.order_timeout_bars = runtime_config.get('order_timeout_bars')
+        self.stop_loss = float(runtime_config.get('stop_loss_pct', 0)) / 100
+
+        trailing_stop_config = trailing_stop_config or {}
+        self.trail_activation = float(trailing_stop_config.get('activation_percent', 0)) / 100
+        self.trail = float(trailing_stop_config.get('trail_percent', 0)) / 100
+
+        self.indicators = []
+        for config in indicator_configs or []:
+            try:
+                indicator = get_indicator_class(config['code'])(**resolve_parameters(config.get('params'), self.run_parameters))
+            except (KeyError, IndicatorValidationError) as e:
+                raise BacktestConfigurationError(f"Invalid indicator config {config}: {str(e)}")
+            self.indicators.append((config.get('alias') or config['code'].lower(), indicator))
+        self.price_actions = []
+        for config in price_action_configs or []:
+            code = (config.get('code') or '').upper()
+            if code not in _PRICE_ACTION_CALCULATORS:
+                raise BacktestConfigurationError(f"No vectorized implementation registered for price action pattern '{code}'.")
+            self.price_actions.append((config.get('alias') or code.lower(), _PRICE_ACTION_CALCULATORS[code],
+                                       resolve_parameters(config.get('params'), self.run_parameters)))
+        self.window = deque(maxlen=int(runtime_config.get('feature_window', 200)))
+
+        self.entry_conditions = self.run_parameters.get('entry_conditions')
+        self.exit_conditions = self.run_parameters.get('exit_conditions')
+        self._referenced_series = {
+            operand
+            for condition in (self.entry_conditions or []) + (self.exit_conditions or [])
+            for operand in (condition.get('left'), condition.get('right'))
+            if isinstance(operand, str) and not operand.startswith('$')
+        }
+
+        self._heap = []
+        self._seq = itertools.count()
+        self._order_ids = itertools.count(1)
+        self._bar = None # [bucket, open, high, low, close, volume]
+        self._bar_index = 0
+        self._previous_features: Optional[Dict[str, float]] = None
+        self._entry_order: Optional[SimOrder] = None
+        self._exit_order: Optional[SimOrder] = None
+        self._extreme: Optional[float] = None
+        self.fills: List[Fill] = []
+        self.bar_timestamps: List[int] = []
+        self.equity: List[float] = []
+        self.held: List[bool] = []
+        self.events = 0
+
+    # --- حلقه رویداد ---
+    def _push(self, event, priority: int, source=None):
+        heapq.heappush(self._heap, (event.timestamp, priority, next(self._seq), event, source))
+
+    def _push_next(self, source, priority: int):
+        event = next(source, None)
+        if event is not None:
+            self._push(event, priority, source)
+
+    def run(self) -> BacktestOutcome:
+        started = time.perf_counter()
+        self._push_next(iter_tick_events(self.dataset), PRIORITY_TICK)
+        self._push_next(iter_book_events(self.dataset), PRIORITY_BOOK)
+
+        heap = self._heap
+        while heap:
+            _, priority, _, event, source = heapq.heappop(heap)
+            if source is not None:
+                self._push_next(source, priority)
+            self.events += 1
+            if priority == PRIORITY_TICK:
+                self._on_tick(event)
+            elif priority == PRIORITY_BOOK:
+                self._apply_fills(self.matcher.on_book(event))
+            elif event.order.is_active:
+                self._apply_fills(self.matcher.submit(event.order, event.timestamp))
+
+        self._finish()
+        elapsed = time.perf_counter() - started
+        outcome = self._build_outcome()
+        outcome.summary.update({
+            'engine': 'event_driven',
+            'events': self.events,
+            'events_per_second': self.events / elapsed if elapsed > 0 else None,
+            'duration_seconds': elapsed,
+        })
+        return outcome
+
+    def _on_tick(self, tick: TickEvent):
+        bucket = tick.timestamp - tick.timestamp % self.bar_ms
+        if self._bar is not None and bucket > self._bar[0]:
+            self._close_bar()
+        self._apply_fills(self.matcher.on_trade(tick))
+
+        if self._bar is None:
+            self._bar = [bucket, tick.price, tick.price, tick.price, tick.price, tick.quantity]
+        else:
+            bar = self._bar
+            bar[2] = max(bar[2], tick.price)
+            bar[3] = min(bar[3], tick.price)
+            bar[4] = tick.price
+            bar[5] += tick.quantity
+        self._check_stops(tick.price, tick.timestamp)
+
+    def _apply_fills(self, fills: List[Fill]):
+        for fill in fills:
+            self.portfolio.apply(fill)
+            self.fills.append(fill)
+            if fill.opening:
+                self._extreme = fill.price if self._extreme is None else self._extreme
+        if fills and self.portfolio.position == 0.0:
+            # رفت‌وبرگشت بسته شد
+            if self._entry_order is not None:
+                self.matcher.cancel(self._entry_order)
+            self._entry_order = self._exit_order = None
+            self._extreme = None
+
+    # --- منطق استراتژی ---
+    def _submit(self, side: str, quantity: float, timestamp: int, reason: str, order_type: str = ORDER_MARKET,
+                limit_price: Optional[float] = None) -> SimOrder:
+        order = SimOrder(f"O{next(self._order_ids)}", side, quantity, order_type, limit_price, reason, self._bar_index)
+        self._push(OrderEvent(timestamp + self.latency_ms, order), PRIORITY_ORDER)
+        return order
+
+    def _submit_exit(self, timestamp: int, reason: str):
+        if self._entry_order is not None and self._entry_order.is_active:
+            self.matcher.cancel(self._entry_order)
+        quantity = abs(self.portfolio.position)
+        if quantity > EPSILON:
+            self._exit_order = self._submit(self.exit_side, quantity, timestamp, reason)
+
+    def _check_stops(self, price: float, timestamp: int):
+        position = self.portfolio.position
+        if position == 0.0 or (self._exit_order is not None and self._exit_order.is_active):
+            return
+        entry = self.portfolio.avg_price
+        if self.stop_loss and self.sign * (price - entry) / entry <= -self.stop_loss:
+            self._submit_exit(timestamp, EXIT_REASON_STOP_LOSS)
+            return
+        if self.trail:
+            self._extreme = max(self._extreme, price) if self.sign > 0 else min(self._extreme, price)
+            favorable = self.sign * (self._extreme - entry) / entry
+            retrace = self.sign * (self._extreme - price) / self._extreme
+            if favorable >= self.trail_activation and retrace >= self.trail:
+                self._submit_exit(timestamp, EXIT_REASON_TRAILING_STOP)
+
+    def _current_features(self, bar_dict: Dict[str, float]) -> Dict[str, float]:
+        # سری‌های ارجاع‌شده در شرط‌ها تا پایان گرم‌شدن اندیکاتورها NaN هستند
+        features = dict.fromkeys(self._referenced_series, np.nan)
+        features.update({name: bar_dict[name] for name in ('open', 'high', 'low', 'close', 'volume')})
+        for alias, indicator in self.indicators:
+            value = indicator.on_bar(bar_dict) or {}
+            for name, number in value.items():
+                features[alias if name == 'value' or len(value) == 1 else f"{alias}.{name}"] = number
+        if self.price_actions:
+            window = np.array(self.window, dtype=np.float64)
+            arrays = OHLCVArrays(
+                timestamp=window[:, 0].astype(np.int64), open_price=window[:, 1], high_price=window[:, 2],
+                low_price=window[:, 3], close_price=window[:, 4], volume=window[:, 5],
+            )
+            for alias, calculator, params in self.price_actions:
+                outputs = calculator(arrays, **params)
+                for name, series in outputs.items():
+                    features[alias if len(outputs) == 1 else f"{alias}.{name}"] = float(series[-1])
+        return features
+
+    def _signal(self, conditions, features: Dict[str, float]) -> bool:
+        if not conditions:
+            return False
+        previous = self._previous_features or {}
+        pairs = {name: np.array([previous.get(name, np.nan), value], dtype=np.float64) for name, value in features.items()}
+        return bool(evaluate_conditions(pairs, conditions, self.run_parameters, 2)[-1])
+
+    def _close_bar(self):
+        bucket, open_price, high, low, close, volume = self._bar
+        self._bar = None
+        bar_dict = {'timestamp': bucket, 'open': open_price, 'high': high, 'low': low, 'close': close, 'volume': volume}
+        self.window.append((bucket, open_price, high, low, close, volume))
+        features = self._current_features(bar_dict)
+        entry_signal = self._signal(self.entry_conditions, features)
+        exit_signal = self._signal(self.exit_conditions, features)
+        self._previous_features = features
+
+        self.bar_timestamps.append(bucket)
+        self.equity.append(self.portfolio.equity(close))
+        self.held.append(self.portfolio.position != 0.0)
+        self._bar_index += 1
+        timestamp = bucket + self.bar_ms
+
+        entry = self._entry_order
+        if entry is not None and entry.is_active and self.order_timeout_bars is not None \
+                and self._bar_index - entry.created_bar >= int(self.order_timeout_bars):
+            self.matcher.cancel(entry)
+
+        in_position = self.portfolio.position != 0.0
+        exit_pending = self._exit_order is not None and self._exit_order.is_active
+        if in_position and exit_signal and not exit_pending:
+            self._submit_exit(timestamp, EXIT_REASON_SIGNAL)
+        elif not in_position and entry_signal and not exit_signal and (entry is None or not entry.is_active):
+            notional = trade_notional(self.portfolio.equity(close), self.stop_loss or None,
+                                      self.position_size_mode, self.position_size_value)
+            quantity = max(notional, 0.0) / close
+            if quantity > EPSILON:
+                if self.order_type == ORDER_LIMIT:
+                    limit_price = close * (1 - self.sign * self.limit_offset)
+                    self._entry_order = self._submit(self.entry_side, quantity, timestamp, ENTRY_REASON, ORDER_LIMIT, limit_price)
+                else:
+                    self._entry_order = self._submit(self.entry_side, quantity, timestamp, ENTRY_REASON)
+
+    def _finish(self):
+        last_price = self._bar[4] if self._bar is not None else self.matcher.last_price
+        if self._bar is not None:
+            self._close_bar()
+        for order in list(self.matcher.resting):
+            self.matcher.cancel(order)
+        if self.portfolio.position != 0.0 and last_price is not None:
+            timestamp = self.bar_timestamps[-1] if self.bar_timestamps else 0
+            order = SimOrder(f"O{next(self._order_ids)}", self.exit_side, abs(self.portfolio.position), reason=EXIT_REASON_END_OF_DATA)
+            self._apply_fills([self.matcher._fill(order, last_price, order.quantity, timestamp)])
+            if self.equity:
+                self.equity[-1] = self.portfolio.equity(last_price)
+
+    # --- خروجی ---
+    def _build_outcome(self) -> BacktestOutcome:
+        by_trade: Dict[int, List[Fill]] = {}
+        for fill in self.fills:
+            by_trade.setdefault(fill.trade_no, []).append(fill)
+
+        bar_timestamps = np.asarray(self.bar_timestamps, dtype=np.int64)
+        columns = {name: [] for name in ('entry_index', 'exit_index', 'entry_timestamp', 'exit_timestamp', 'entry_price',
+                                         'exit_price', 'quantity', 'pnl', 'commission', 'exit_reason')}
+        for trade_no in sorted(by_trade):
+            fills = by_trade[trade_no]
+            opening = [f for f in fills if f.opening]
+            closing = [f for f in fills if not f.opening]
+            quantity = sum(f.quantity for f in opening)
+            closed_qty = sum(f.quantity for f in closing)
+            columns['entry_timestamp'].append(opening[0].timestamp)
+            columns['exit_timestamp'].append(fills[-1].timestamp)
+            columns['entry_price'].append(sum(f.price * f.quantity for f in opening) / quantity)
+            columns['exit_price'].append(sum(f.price * f.quantity for f in closing) / closed_qty if closed_qty else np.nan)
+            columns['quantity'].append(quantity)
+            columns['pnl'].append(sum(f.pnl for f in fills))
+            columns['commission'].append(sum(f.fee for f in fills))
+            columns['exit_reason'].append(closing[-1].reason if closing else EXIT_REASON_END_OF_DATA)
+        trades = {name: np.asarray(values, dtype=object if name == 'exit_reason' else np.float64) for name, values in columns.items()}
+        for name in ('entry_timestamp', 'exit_timestamp'):
+            trades[name] = trades[name].astype(np.int64)
+        trades['entry_index'] = np.searchsorted(bar_timestamps, trades['entry_timestamp'], side='right') - 1
+        trades['exit_index'] = np.searchsorted(bar_timestamps, trades['exit_timestamp'], side='right') - 1
+
+        equity = np.asarray(self.equity, dtype=np.float64)
+        summary = summarize(equity, trades, np.asarray(self.held, dtype=bool), self.initial_capital, self.timeframe)
+        orders = {}
+        for fill in self.fills:
+            orders[fill.order_id] = orders.get(fill.order_id, 0) + 1
+        summary.update({
+            'fills': len(self.fills),
+            'partially_filled_orders': sum(1 for count in orders.values() if count > 1),
+        })
+        return BacktestOutcome(trades, equity, summary, fills=self.fills)
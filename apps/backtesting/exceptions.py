@@ -0,0 +1,29 @@
+# apps/backtesting/exceptions.py
+
+from rest_framework.exceptions import APIException
+from django.utils.translation import gettext_lazy as _
+
+class BacktestError(APIException):
+    """
+    Base exception class for all backtesting related errors.
+    """
+    status_code = 500
+    default_detail = _('An error occurred while running the backtest.')
+    default_code = 'backtest_error'
+
+class BacktestConfigurationError(BacktestError):
+    """
+    Raised when the strategy version or run parameters cannot be turned into a backtest
+    (unknown indicator/pattern code, invalid condition, missing parameter).
+    """
+    status_code = 400
+    default_detail = _('Invalid backtest configuration.')
+    default_code = 'backtest_configuration_error'
+
+class BacktestDataError(BacktestError):
+    """
+    Raised when no usable market data exists for the run's instrument, timeframe and date range.
+    """
+    status_code = 404
+    default_detail = _('No market data available for this backtest.')
+    default_code = 'backtest_data_error'
@@ -0,0 +1,424 @@
+# apps/backtesting/optimization.py
+
+"""
+Parameter sweeps and walk-forward optimization on top of the vectorized engine.
+
+StrategyVersion.parameters_schema describes the tunable parameters, either as a flat map
+or JSON-Schema style under "properties":
+
+    {"fast": {"type": "int", "min": 5, "max": 50, "step": 5},
+     "slow": {"type": "int", "values": [50, 100, 200]},
+     "mult": {"type": "float", "minimum": 1.0, "maximum": 3.0, "multipleOf": 0.5}}
+
+Candles are loaded once and written as one .npy file per column; local pool workers open
+them with np.load(mmap_mode='r'), so every process shares the same page-cache pages
+read-only. Celery workers load the run's candles from the columnar store / DB instead.
+"""
+
+import itertools
+import logging
+import math
+import os
+import shutil
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Generator, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from apps.market_data.storage import COLUMNS, OHLCVArrays, get_columnar_root
+from .exceptions import BacktestConfigurationError, BacktestError
+from .vectorized import run_vectorized_backtest
+
+logger = logging.getLogger(__name__)
+
+SEARCH_GRID = 'grid'
+SEARCH_RANDOM = 'random'
+SEARCH_BAYESIAN = 'bayesian'
+
+BACKEND_SERIAL = 'serial'
+BACKEND_PROCESS = 'process'
+BACKEND_CELERY = 'celery'
+
+DEFAULT_OBJECTIVE = 'sharpe_ratio'
+DAY_MS = 86_400_000
+
+# ستون‌های خلاصه که در جدول رتبه‌بندی نگه داشته می‌شوند
+RANKED_METRICS = ('total_return_pct', 'sharpe_ratio', 'max_drawdown_pct', 'num_trades', 'win_rate_pct', 'profit_factor')
+
+
+# --- فضای پارامتر ---
+
+class ParameterSpace:
+    """
+    Discrete/continuous search space built from StrategyVersion.parameters_schema.
+    """
+
+    def __init__(self, schema: Dict[str, Any]):
+        schema = schema or {}
+        properties = schema.get('properties', schema)
+        self.dimensions = []
+        for name, spec in properties.items():
+            if not isinstance(spec, dict):
+                continue
+            values = spec.get('values', spec.get('enum'))
+            kind = str(spec.get('type', 'float')).lower()
+            low = spec.get('min', spec.get('minimum'))
+            high = spec.get('max', spec.get('maximum'))
+            if values is None and (low is None or high is None):
+                continue # پارامتر غیرقابل تنظیم (بدون بازه)
+            is_int = kind in ('int', 'integer')
+            step = spec.get('step', spec.get('multipleOf', 1 if is_int else None))
+            self.dimensions.append({
+                'name': name,
+                'values': list(values) if values is not None else None,
+                'low': float(low) if low is not None else None,
+                'high': float(high) if high is not None else None,
+                'step': float(step) if step else None,
+                'is_int': is_int,
+                'grid_points': int(spec.get('grid_points', 10)),
+            })
+        if not self.dimensions:
+            raise BacktestConfigurationError("parameters_schema does not define any tunable parameter (needs values or min/max).")
+
+    @property
+    def names(self) -> List[str]:
+        return [dim['name'] for dim in self.dimensions]
+
+    def _cast(self, dim: Dict, value: float):
+        if dim['step']:
+            value = dim['low'] + round((value - dim['low']) / dim['step']) * dim['step']
+        value = min(max(value, dim['low']), dim['high'])
+        return int(round(value)) if dim['is_int'] else round(float(value), 10)
+
+    def axis(self, dim: Dict) -> list:
+        if dim['values'] is not None:
+            return dim['values']
+        if dim['step']:
+            count = int(math.floor((dim['high'] - dim['low']) / dim['step'] + 1e-9)) + 1
+            return [self._cast(dim, dim['low'] + i * dim['step']) for i in range(count)]
+        return [self._cast(dim, value) for value in np.linspace(dim['low'], dim['high'], dim['grid_points'])]
+
+    def grid(self) -> Iterable[Dict[str, Any]]:
+        axes = [self.axis(dim) for dim in self.dimensions]
+        for combination in itertools.product(*axes):
+            yield dict(zip(self.names, combination))
+
+    def grid_size(self) -> int:
+        return int(np.prod([len(self.axis(dim)) for dim in self.dimensions]))
+
+    def from_unit(self, point: np.ndarray) -> Dict[str, Any]:
+        params = {}
+        for dim, u in zip(self.dimensions, point):
+            u = float(min(max(u, 0.0), 1.0))
+            if dim['values'] is not None:
+                params[dim['name']] = dim['values'][min(int(u * len(dim['values'])), len(dim['values']) - 1)]
+            else:
+                params[dim['name']] = self._cast(dim, dim['low'] + u * (dim['high'] - dim['low']))
+        return params
+
+    def to_unit(self, params: Dict[str, Any]) -> np.ndarray:
+        point = []
+        for dim in self.dimensions:
+            value = params[dim['name']]
+            if dim['values'] is not None:
+                point.append((dim['values'].index(value) + 0.5) / len(dim['values']))
+            else:
+                span = dim['high'] - dim['low']
+                point.append((float(value) - dim['low']) / span if span else 0.5)
+        return np.array(point)
+
+    def sample(self, rng: np.random.Generator) -> Dict[str, Any]:
+        return self.from_unit(rng.random(len(self.dimensions)))
+
+
+def suggest_tpe(space: ParameterSpace, history: List[tuple], rng: np.random.Generator,
+                n_candidates: int = 48, gamma: float = 0.25, bandwidth: float = 0.15) -> Dict[str, Any]:
+    """
+    Tree-structured Parzen estimator step: proposes the candidate (around the best
+    observed points) that maximizes the ratio of good/bad kernel densities.
+    `history` is a list of (params, score) with higher scores being better.
+    """
+    points = np.array([space.to_unit(params) for params, _ in history])
+    scores = np.array([score for _, score in history], dtype=np.float64)
+    order = np.argsort(-scores)
+    n_good = max(1, int(math.ceil(gamma * len(history))))
+    good, bad = points[order[:n_good]], points[order[n_good:]]
+
+    candidates = good[rng.integers(len(good), size=n_candidates)] + rng.normal(0, bandwidth, (n_candidates, points.shape[1]))
+    candidates = np.clip(candidates, 0.0, 1.0)
+
+    def density(samples, centers):
+        if not len(centers):
+            return np.ones(len(samples))
+        distances = ((samples[:, None, :] - centers[None, :, :]) / bandwidth) ** 2
+        return np.exp(-0.5 * distances.sum(axis=2)).mean(axis=1) + 1e-12
+
+    ratio = density(candidates, good) / density(candidates, bad)
+    return space.from_unit(candidates[int(np.argmax(ratio))])
+
+
+# --- داده مشترک فقط‌خواندنی ---
+
+class SharedMarketData:
+    """
+    Writes OHLCVArrays once as one .npy per column and reopens them memory-mapped
+    (read-only) in every worker process.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    @classmethod
+    def create(cls, arrays: OHLCVArrays, root: Optional[str] = None) -> 'SharedMarketData':
+        path = os.path.join(root or get_columnar_root(), 'sweeps', uuid.uuid4().hex)
+        os.makedirs(path, exist_ok=True)
+        for name in COLUMNS:
+            np.save(os.path.join(path, f"{name}.npy"), np.ascontiguousarray(getattr(arrays, name)))
+        return cls(path)
+
+    def load(self) -> OHLCVArrays:
+        return OHLCVArrays(**{name: np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode='r') for name in COLUMNS})
+
+    def cleanup(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+# داده هر پروسس کارگر (یک بار برای هر مسیر یا اجرای بک‌تست)
+_WORKER_DATA: Dict[str, OHLCVArrays] = {}
+
+
+def _worker_arrays(job: Dict[str, Any]) -> OHLCVArrays:
+    """
+    Local pools share a memory-mapped copy (`data_path`); Celery workers may run on other
+    hosts, so they load the run's candles themselves (`run_id`, columnar store / DB).
+    """
+    key = job['data_path'] if job.get('data_path') else f"run:{job['run_id']}"
+    arrays = _WORKER_DATA.get(key)
+    if arrays is None:
+        _WORKER_DATA.clear()
+        if job.get('data_path'):
+            arrays = SharedMarketData(job['data_path']).load()
+        else:
+            from .models import BacktestRun # Import داخل تابع برای جلوگیری از حلقه
+            from .services import BacktestService
+            run = BacktestRun.objects.select_related('instrument', 'exchange_account__exchange').get(id=job['run_id'])
+            arrays = BacktestService.load_market_data(run)
+        _WORKER_DATA[key] = arrays
+    return arrays
+
+
+def _slim_summary(summary: Dict[str, Any]) -> Dict[str, Any]:
+    return {name: summary.get(name) for name in RANKED_METRICS}
+
+
+def evaluate_parameter_set(job: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Runs one backtest on the shared arrays (top-level so it can be pickled for worker
+    processes or called from a Celery task). Clearly losing sets are stopped after the
+    early-stopping probe segment instead of running the whole window.
+    """
+    spec = job['spec']
+    params = job['parameters']
+    arrays = _worker_arrays(job).slice_range(job.get('start_ms'), job.get('end_ms'))
+    run_parameters = {**spec.get('base_parameters', {}), **params}
+    kwargs = {
+        'indicator_configs': spec.get('indicator_configs'),
+        'price_action_configs': spec.get('price_action_configs'),
+        'run_parameters': run_parameters,
+        'runtime_config': spec.get('runtime_config'),
+        'initial_capital': spec.get('initial_capital', 10_000.0),
+        'position_size_mode': spec.get('position_size_mode', 'percent'),
+        'position_size_value': spec.get('position_size_value', 100.0),
+        'timeframe': spec.get('timeframe'),
+    }
+    try:
+        early_stopping = job.get('early_stopping') or {}
+        fraction = float(early_stopping.get('probe_fraction', 0))
+        if 0 < fraction < 1 and len(arrays):
+            probe_end = int(arrays.timestamp[int(len(arrays) * fraction) - 1]) if int(len(arrays) * fraction) else None
+            if probe_end is not None:
+                probe = run_vectorized_backtest(arrays.slice_range(None, probe_end), **kwargs).summary
+                if probe['total_return_pct'] <= float(early_stopping.get('min_return_pct', -float('inf'))) \
+                        or probe['max_drawdown_pct'] >= float(early_stopping.get('max_drawdown_pct', float('inf'))):
+                    return {'parameters': params, 'summary': _slim_summary(probe), 'pruned': True}
+        summary = run_vectorized_backtest(arrays, **kwargs).summary
+        return {'parameters': params, 'summary': _slim_summary(summary), 'pruned': False}
+    except BacktestError as e:
+        return {'parameters': params, 'summary': {}, 'pruned': True, 'error': str(e)}
+
+
+def score_of(result: Dict[str, Any], objective: str) -> float:
+    """
+    Objective value used for ranking; pruned or failed sets rank last. Drawdown is minimized.
+    """
+    value = result.get('summary', {}).get(objective)
+    if value is None or result.get('pruned') or (isinstance(value, float) and math.isnan(value)):
+        return -float('inf')
+    return -float(value) if objective == 'max_drawdown_pct' else float(value)
+
+
+def rank_results(results: List[Dict[str, Any]], objective: str) -> List[Dict[str, Any]]:
+    ranked = sorted(results, key=lambda result: score_of(result, objective), reverse=True)
+    for rank, result in enumerate(ranked, start=1):
+        result['rank'] = rank
+        score = score_of(result, objective)
+        result['score'] = score if math.isfinite(score) else None
+    return ranked
+
+
+# --- اجرای موازی ---
+
+class SweepExecutor:
+    """
+    Evaluates batches of jobs serially or on a local process pool. Celery sweeps do not
+    block on results: each round is a chord whose callback advances the sweep (see
+    ParameterSweepService.start_celery_sweep).
+    """
+
+    def __init__(self, backend: str = BACKEND_PROCESS, max_workers: Optional[int] = None):
+        if backend not in (BACKEND_SERIAL, BACKEND_PROCESS):
+            raise BacktestConfigurationError(f"Unsupported sweep backend '{backend}'.")
+        self.backend = backend
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._pool = None
+
+    def __enter__(self):
+        if self.backend == BACKEND_PROCESS:
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self
+
+    def __exit__(self, *exc):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    def map(self, jobs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        if not jobs:
+            return []
+        if self.backend == BACKEND_SERIAL:
+            return [evaluate_parameter_set(job) for job in jobs]
+        chunksize = max(1, len(jobs) // (self.max_workers * 4))
+        return list(self._pool.map(evaluate_parameter_set, jobs, chunksize=chunksize))
+
+
+def split_batches(jobs: List[Dict[str, Any]], max_workers: int) -> List[List[Dict[str, Any]]]:
+    """
+    Splits a round of jobs into about four batches per worker (one Celery task each).
+    """
+    batch_size = max(1, math.ceil(len(jobs) / (max_workers * 4)))
+    return [jobs[i:i + batch_size] for i in range(0, len(jobs), batch_size)]
+
+
+def run_steps(steps: Generator, executor: SweepExecutor):
+    """
+    Drives a sweep generator (yields job lists, receives their results) to completion.
+    """
+    try:
+        jobs = next(steps)
+        while True:
+            jobs = steps.send(executor.map(jobs))
+    except StopIteration as stop:
+        return stop.value
+
+
+def replay_steps(steps: Generator, rounds: List[List[Dict[str, Any]]]) -> Tuple[bool, Any]:
+    """
+    Feeds the recorded results of finished rounds back into a (deterministic) sweep generator.
+    Returns (False, next_jobs) while rounds remain, or (True, report) once the sweep is done.
+    """
+    try:
+        jobs = next(steps)
+        for results in rounds:
+            jobs = steps.send(results)
+        return False, jobs
+    except StopIteration as stop:
+        return True, stop.value
+
+
+def search_steps(space: ParameterSpace, job_template: Dict[str, Any], method: str = SEARCH_GRID,
+                 n_iter: int = 100, objective: str = DEFAULT_OBJECTIVE, seed: Optional[int] = None,
+                 n_startup: int = 10, batch_size: int = 1) -> Generator:
+    """
+    Search over `space` as a generator: yields each round of jobs, receives their results
+    and returns all evaluated results, ranked. With a fixed seed the rounds are deterministic.
+    """
+    rng = np.random.default_rng(seed)
+    if method == SEARCH_GRID:
+        candidates = list(space.grid())
+        results = yield [{**job_template, 'parameters': params} for params in candidates]
+        return rank_results(results, objective)
+
+    if method == SEARCH_RANDOM:
+        seen, candidates = set(), []
+        for _ in range(n_iter * 10):
+            params = space.sample(rng)
+            key = tuple(sorted(params.items()))
+            if key not in seen:
+                seen.add(key)
+                candidates.append(params)
+            if len(candidates) >= n_iter:
+                break
+        results = yield [{**job_template, 'parameters': params} for params in candidates]
+        return rank_results(results, objective)
+
+    if method != SEARCH_BAYESIAN:
+        raise BacktestConfigurationError(f"Unsupported search method '{method}'.")
+
+    # نمونه‌های اولیه تصادفی، سپس دسته‌های پیشنهادی TPE به اندازه تعداد کارگرها
+    results, seen = [], set()
+    batch_size = max(1, batch_size)
+    while len(results) < n_iter:
+        history = [(result['parameters'], score_of(result, objective)) for result in results]
+        finite = [(params, score) for params, score in history if math.isfinite(score)]
+        batch = []
+        for attempt in range(batch_size * 50):
+            if len(batch) >= min(batch_size, n_iter - len(results)):
+                break
+            # پیشنهاد تکراری TPE با نمونه تصادفی جایگزین می‌شود
+            use_tpe = len(finite) >= n_startup and attempt % 2 == 0
+            params = suggest_tpe(space, finite, rng) if use_tpe else space.sample(rng)
+            key = tuple(sorted(params.items()))
+            if key not in seen:
+                seen.add(key)
+                batch.append(params)
+        if not batch:
+            break # فضای گسسته کامل پیمایش شده است
+        results.extend((yield [{**job_template, 'parameters': params} for params in batch]))
+    return rank_results(results, objective)
+
+
+def search(space: ParameterSpace, executor: SweepExecutor, job_template: Dict[str, Any], method: str = SEARCH_GRID,
+           n_iter: int = 100, objective: str = DEFAULT_OBJECTIVE, seed: Optional[int] = None,
+           n_startup: int = 10) -> List[Dict[str, Any]]:
+    """
+    Expands the search over `space` and returns all evaluated results, ranked.
+    """
+    return run_steps(
+        search_steps(space, job_template, method, n_iter, objective, seed, n_startup, batch_size=executor.max_workers),
+        executor,
+    )
+
+
+def walk_forward_windows(timestamps: np.ndarray, train_days: float, test_days: float,
+                         step_days: Optional[float] = None) -> List[Dict[str, int]]:
+    """
+    Rolling (train, test) windows over the data range, in epoch milliseconds.
+    """
+    if not len(timestamps):
+        return []
+    train_ms, test_ms = int(train_days * DAY_MS), int(test_days * DAY_MS)
+    step_ms = int((step_days or test_days) * DAY_MS)
+    if train_ms <= 0 or test_ms <= 0 or step_ms <= 0:
+        raise BacktestConfigurationError("Walk-forward train/test/step lengths must be positive.")
+    first, last = int(timestamps[0]), int(timestamps[-1])
+    windows, start = [], first
+    while start + train_ms < last:
+        windows.append({
+            'train_start_ms': start,
+            'train_end_ms': start + train_ms - 1,
+            'test_start_ms': start + train_ms,
+            'test_end_ms': min(start + train_ms + test_ms - 1, last),
+        })
+        start += step_ms
+    return windows
@@ -0,0 +1,172 @@
+# apps/backtesting/replay.py
+
+"""
+On-disk replay datasets for the event-driven backtester.
+
+Tick and order-book history is exported once from the database into fixed-size chunks
+of NumPy structured arrays (.npy) and then streamed back chunk by chunk with
+memory-mapped reads, so a replay never holds the whole history in memory and the
+event loop never touches the ORM.
+"""
+
+import glob
+import logging
+import os
+import shutil
+from typing import Iterator, Optional
+
+import numpy as np
+from django.conf import settings
+
+from apps.market_data.storage import get_columnar_root, to_epoch_ms
+
+logger = logging.getLogger(__name__)
+
+TICK_SIDE_BUY = 1
+TICK_SIDE_SELL = -1
+TICK_SIDE_UNKNOWN = 0
+
+TICK_DTYPE = np.dtype([
+    ('timestamp', '<i8'),
+    ('price', '<f8'),
+    ('quantity', '<f8'),
+    ('side', 'i1'),
+])
+
+COMPLETE_MARKER = 'COMPLETE'
+
+
+def get_replay_chunk_size() -> int:
+    return int(getattr(settings, 'BACKTEST_REPLAY_CHUNK_SIZE', 250_000))
+
+
+def get_replay_book_depth() -> int:
+    return int(getattr(settings, 'BACKTEST_REPLAY_BOOK_DEPTH', 20))
+
+
+def get_book_dtype(depth: int) -> np.dtype:
+    """
+    Fixed-depth order book row; missing levels have price NaN and quantity 0.
+    """
+    return np.dtype([
+        ('timestamp', '<i8'),
+        ('bid_price', '<f8', (depth,)),
+        ('bid_qty', '<f8', (depth,)),
+        ('ask_price', '<f8', (depth,)),
+        ('ask_qty', '<f8', (depth,)),
+    ])
+
+
+def _fill_levels(prices: np.ndarray, quantities: np.ndarray, levels, depth: int):
+    prices[:] = np.nan
+    quantities[:] = 0.0
+    for index, level in enumerate((levels or [])[:depth]):
+        prices[index] = float(level[0])
+        quantities[index] = float(level[1])
+
+
+class ReplayDataset:
+    """
+    Chunked tick/order-book history of one instrument for [start_ms, end_ms].
+    Layout: {root}/replay/{key}/{ticks|books}_{chunk:05d}.npy plus a COMPLETE marker.
+    """
+
+    def __init__(self, key: str, start_ms: int, end_ms: int, root: Optional[str] = None, depth: Optional[int] = None):
+        self.key = str(key)
+        self.start_ms = int(start_ms)
+        self.end_ms = int(end_ms)
+        self.depth = depth or get_replay_book_depth()
+        self.path = os.path.join(root or get_columnar_root(), 'replay', self.key, f"{self.start_ms}_{self.end_ms}")
+
+    @property
+    def is_complete(self) -> bool:
+        return os.path.exists(os.path.join(self.path, COMPLETE_MARKER))
+
+    def _chunk_files(self, kind: str):
+        return sorted(glob.glob(os.path.join(self.path, f"{kind}_*.npy")))
+
+    # --- نوشتن ---
+    def reset(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.makedirs(self.path, exist_ok=True)
+
+    def write_tick_chunk(self, index: int, chunk: np.ndarray):
+        np.save(os.path.join(self.path, f"ticks_{index:05d}.npy"), np.asarray(chunk, dtype=TICK_DTYPE))
+
+    def write_book_chunk(self, index: int, chunk: np.ndarray):
+        np.save(os.path.join(self.path, f"books_{index:05d}.npy"), np.asarray(chunk, dtype=get_book_dtype(self.depth)))
+
+    def mark_complete(self):
+        with open(os.path.join(self.path, COMPLETE_MARKER), 'w') as marker:
+            marker.write('1')
+
+    def export_from_db(self, tick_config=None, book_config=None, chunk_size: Optional[int] = None):
+        """
+        Streams MarketDataTick / MarketDataOrderBook rows (ordered by timestamp) into chunk files.
+        Only one chunk is held in memory at a time.
+        """
+        from apps.market_data.models import MarketDataOrderBook, MarketDataTick # Import داخل تابع برای جلوگیری از حلقه
+        from apps.market_data.order_book_codec import decode_order_book
+        from apps.market_data.storage import from_epoch_ms
+
+        chunk_size = chunk_size or get_replay_chunk_size()
+        self.reset()
+        start, end = from_epoch_ms(self.start_ms), from_epoch_ms(self.end_ms)
+
+        if tick_config is not None:
+            rows = (
+                MarketDataTick.objects.filter(config=tick_config, timestamp__gte=start, timestamp__lte=end)
+                .order_by('timestamp')
+                .values_list('timestamp', 'price', 'quantity', 'side')
+                .iterator(chunk_size=chunk_size)
+            )
+            buffer = np.empty(chunk_size, dtype=TICK_DTYPE)
+            count = chunk_index = 0
+            for timestamp, price, quantity, side in rows:
+                buffer[count] = (to_epoch_ms(timestamp), float(price), float(quantity),
+                                 TICK_SIDE_BUY if side == 'BUY' else TICK_SIDE_SELL if side == 'SELL' else TICK_SIDE_UNKNOWN)
+                count += 1
+                if count == chunk_size:
+                    self.write_tick_chunk(chunk_index, buffer)
+                    chunk_index, count = chunk_index + 1, 0
+            if count:
+                self.write_tick_chunk(chunk_index, buffer[:count])
+
+        if book_config is not None:
+            rows = (
+                MarketDataOrderBook.objects.filter(config=book_config, timestamp__gte=start, timestamp__lte=end)
+                .order_by('timestamp')
+                .values_list('timestamp', 'bids', 'asks', 'encoded_book')
+                .iterator(chunk_size=chunk_size)
+            )
+            buffer = np.empty(chunk_size, dtype=get_book_dtype(self.depth))
+            count = chunk_index = 0
+            for timestamp, bids, asks, encoded_book in rows:
+                if encoded_book:
+                    decoded = decode_order_book(encoded_book)
+                    bids, asks = decoded.bids.tolist(), decoded.asks.tolist()
+                row = buffer[count]
+                row['timestamp'] = to_epoch_ms(timestamp)
+                _fill_levels(row['bid_price'], row['bid_qty'], bids, self.depth)
+                _fill_levels(row['ask_price'], row['ask_qty'], asks, self.depth)
+                count += 1
+                if count == chunk_size:
+                    self.write_book_chunk(chunk_index, buffer)
+                    chunk_index, count = chunk_index + 1, 0
+            if count:
+                self.write_book_chunk(chunk_index, buffer[:count])
+
+        self.mark_complete()
+        logger.info(f"Exported replay dataset {self.path}.")
+
+    # --- خواندن ---
+    def iter_tick_chunks(self) -> Iterator[np.ndarray]:
+        for path in self._chunk_files('ticks'):
+            yield np.load(path, mmap_mode='r')
+
+    def iter_book_chunks(self) -> Iterator[np.ndarray]:
+        for path in self._chunk_files('books'):
+            yield np.load(path, mmap_mode='r')
+
+    def has_books(self) -> bool:
+        return bool(self._chunk_files('books'))
@@ -1,6 +1,7 @@
 # apps/backtesting/serializers.py
 from rest_framework import serializers
 from .models import BacktestRun, BacktestResult
+from .optimization import DEFAULT_OBJECTIVE, RANKED_METRICS, SEARCH_BAYESIAN, SEARCH_GRID, SEARCH_RANDOM
 
 
 class BacktestRunSerializer(serializers.ModelSerializer):
@@ -18,4 +19,29 @@ class BacktestRunSerializer(serializers.ModelSerializer):
 class BacktestResultSerializer(serializers.ModelSerializer):
     class Meta:
         model = BacktestResult
-        fields = '__all__'
\ No newline at end of file
+        fields = '__all__'
+
+
+class WalkForwardOptionsSerializer(serializers.Serializer):
+    train_days = serializers.FloatField(min_value=0.01)
+    test_days = serializers.FloatField(min_value=0.01)
+    step_days = serializers.FloatField(min_value=0.01, required=False, allow_null=True)
+
+
+class EarlyStoppingOptionsSerializer(serializers.Serializer):
+    probe_fraction = serializers.FloatField(min_value=0.0, max_value=1.0)
+    min_return_pct = serializers.FloatField(required=False)
+    max_drawdown_pct = serializers.FloatField(required=False)
+
+
+class ParameterSweepOptionsSerializer(serializers.Serializer):
+    """
+    Options of a parameter sweep request (validated before the sweep is queued).
+    """
+    method = serializers.ChoiceField(choices=[SEARCH_GRID, SEARCH_RANDOM, SEARCH_BAYESIAN], default=SEARCH_GRID)
+    n_iter = serializers.IntegerField(min_value=1, max_value=10_000, default=100)
+    objective = serializers.ChoiceField(choices=list(RANKED_METRICS), default=DEFAULT_OBJECTIVE)
+    walk_forward = WalkForwardOptionsSerializer(required=False, allow_null=True)
+    early_stopping = EarlyStoppingOptionsSerializer(required=False, allow_null=True)
+    persist_top = serializers.IntegerField(min_value=0, max_value=200, default=10)
+    seed = serializers.IntegerField(min_value=0, max_value=2 ** 32 - 1, required=False, allow_null=True)
@@ -0,0 +1,559 @@
+# apps/backtesting/services.py
+
+import logging
+import os
+import time
+import numpy as np
+from decimal import Decimal
+from django.db import transaction
+from django.utils import timezone
+from apps.core.metrics import metrics
+from apps.market_data.resampling import get_bucket_offset_ms, resample_ohlcv
+from apps.market_data.rollups import ROLLUP_SOURCE_TIMEFRAME
+from apps.market_data.storage import OHLCVArrays, from_epoch_ms, load_ohlcv_arrays
+from .exceptions import BacktestConfigurationError, BacktestDataError
+from .models import BacktestRun, BacktestResult
+from .optimization import (
+    BACKEND_CELERY,
+    BACKEND_PROCESS,
+    DEFAULT_OBJECTIVE,
+    SEARCH_GRID,
+    ParameterSpace,
+    SharedMarketData,
+    SweepExecutor,
+    replay_steps,
+    run_steps,
+    search_steps,
+    split_batches,
+    walk_forward_windows,
+)
+from .replay import ReplayDataset
+from .vectorized import BacktestOutcome, DIRECTION_SHORT, run_vectorized_backtest
+
+logger = logging.getLogger(__name__)
+
+METRIC_PREFIX = 'backtesting.vectorized'
+
+ENGINE_VECTORIZED = 'vectorized'
+ENGINE_EVENT_DRIVEN = 'event_driven'
+
+
+class BacktestService:
+    """
+    Runs BacktestRun instances (vectorized engine by default, event-driven when
+    runtime_config['engine'] == 'event_driven') and stores the results.
+    """
+    RESULT_BATCH_SIZE = 5000
+
+    @staticmethod
+    def get_ohlcv_configs(run: BacktestRun):
+        """
+        (config of the run's timeframe, 1m source config) for the run's instrument; either may be None.
+        """
+        from apps.market_data.models import MarketDataConfig # Import داخل تابع برای جلوگیری از حلقه
+
+        configs = MarketDataConfig.objects.select_related('data_source').filter(instrument=run.instrument, data_type='OHLCV')
+        if run.exchange_account_id:
+            preferred = configs.filter(data_source__name__iexact=run.exchange_account.exchange.name)
+            if preferred.exists():
+                configs = preferred
+        return configs.filter(timeframe=run.timeframe).first(), configs.filter(timeframe=ROLLUP_SOURCE_TIMEFRAME).first()
+
+    @staticmethod
+    def load_market_data(run: BacktestRun) -> OHLCVArrays:
+        """
+        Loads the run's candles as arrays (columnar store first, DB fallback). If the
+        timeframe has no dedicated config, 1m candles are resampled on the fly.
+        """
+        config, source_config = BacktestService.get_ohlcv_configs(run)
+        if config is not None:
+            arrays = load_ohlcv_arrays(config, run.start_datetime, run.end_datetime)
+            if len(arrays):
+                return arrays
+
+        if source_config is not None and run.timeframe != ROLLUP_SOURCE_TIMEFRAME:
+            source = load_ohlcv_arrays(source_config, run.start_datetime, run.end_datetime)
+            if len(source):
+                offset_ms = get_bucket_offset_ms(run.timeframe, data_source=source_config.data_source)
+                return resample_ohlcv(source, run.timeframe, offset_ms)
+
+        raise BacktestDataError(
+            f"No OHLCV data for {run.instrument.symbol} ({run.timeframe}) between {run.start_datetime} and {run.end_datetime}."
+        )
+
+    @staticmethod
+    def check_data_coverage(run: BacktestRun):
+        """
+        Coverage report of the run's candle range from the coverage index (no candle scan), or None
+        if the instrument has no OHLCV config. With runtime_config['require_complete_data'] a gap
+        raises BacktestDataError before any data is loaded.
+        """
+        from apps.market_data.coverage import get_coverage_report # Import داخل تابع برای جلوگیری از حلقه
+
+        config, source_config = BacktestService.get_ohlcv_configs(run)
+        config = config or source_config
+        if config is None:
+            return None
+        report = get_coverage_report(config, run.start_datetime, run.end_datetime, limit=20)
+        report['config_id'] = str(config.id)
+        report['timeframe'] = config.timeframe
+        if not report['is_complete']:
+            logger.warning(
+                f"Backtest run {run.id}: {report['missing_bars']} of {report['expected_bars']} {config.timeframe} bars "
+                f"missing in {report['missing_range_count']} ranges."
+            )
+            if run.runtime_config.get('require_complete_data'):
+                raise BacktestDataError(
+                    f"OHLCV data for {run.instrument.symbol} ({config.timeframe}) is incomplete: "
+                    f"{report['missing_bars']} bars missing between {run.start_datetime} and {run.end_datetime}."
+                )
+        return report
+
+    @staticmethod
+    def run_arrays(run: BacktestRun, arrays: OHLCVArrays) -> BacktestOutcome:
+        """
+        Runs the vectorized engine for `run` on already-loaded arrays (no DB access).
+        """
+        version = run.strategy_version
+        started = time.perf_counter()
+        outcome = run_vectorized_backtest(
+            arrays,
+            indicator_configs=version.indicator_configs,
+            price_action_configs=version.price_action_configs,
+            run_parameters=run.parameters,
+            runtime_config=run.runtime_config,
+            initial_capital=float(run.initial_capital) or 10_000.0,
+            position_size_mode=run.position_size_mode,
+            position_size_value=float(run.position_size_value),
+            timeframe=run.timeframe,
+        )
+        elapsed = time.perf_counter() - started
+        bars_per_second = len(arrays) / elapsed if elapsed > 0 else None
+        outcome.summary.update({
+            'engine': 'vectorized',
+            'duration_seconds': elapsed,
+            'bars_per_second': bars_per_second,
+        })
+        metrics.observe(f'{METRIC_PREFIX}.duration_ms', elapsed * 1000)
+        if bars_per_second:
+            metrics.observe(f'{METRIC_PREFIX}.bars_per_second', bars_per_second)
+        return outcome
+
+    @staticmethod
+    def get_replay_dataset(run: BacktestRun) -> ReplayDataset:
+        """
+        Returns the on-disk tick/order-book replay dataset for the run, exporting it
+        from the database (in chunks) the first time it is needed.
+        """
+        from apps.market_data.models import MarketDataConfig # Import داخل تابع برای جلوگیری از حلقه
+        from apps.market_data.storage import to_epoch_ms
+
+        configs = MarketDataConfig.objects.filter(instrument=run.instrument)
+        tick_config = configs.filter(data_type__in=['TICK', 'TRADES']).first()
+        if tick_config is None:
+            raise BacktestDataError(f"No tick data config for {run.instrument.symbol}; event-driven backtests replay ticks.")
+        book_config = configs.filter(data_type='ORDER_BOOK', data_source_id=tick_config.data_source_id).first()
+
+        key = f"{tick_config.id}_{book_config.id if book_config else 'nobook'}"
+        dataset = ReplayDataset(key, to_epoch_ms(run.start_datetime), to_epoch_ms(run.end_datetime))
+        if not dataset.is_complete:
+            dataset.export_from_db(tick_config=tick_config, book_config=book_config)
+        return dataset
+
+    @staticmethod
+    def get_trailing_stop_config(run: BacktestRun) -> dict:
+        """
+        Trailing stop settings: runtime_config['trailing_stop'] or the RiskProfile
+        referenced by runtime_config['risk_profile_id'] (if it enables trailing stops).
+        """
+        if run.runtime_config.get('trailing_stop'):
+            return run.runtime_config['trailing_stop']
+        risk_profile_id = run.runtime_config.get('risk_profile_id')
+        if not risk_profile_id:
+            return {}
+        from apps.risk.models import RiskProfile # Import داخل تابع برای جلوگیری از حلقه
+        profile = RiskProfile.objects.filter(id=risk_profile_id).first()
+        return profile.trailing_stop_config if profile is not None and profile.use_trailing_stop else {}
+
+    @staticmethod
+    def run_event_driven(run: BacktestRun) -> BacktestOutcome:
+        """
+        Replays tick and order-book history through the event-driven engine.
+        All ORM access happens before the event loop starts.
+        """
+        from .event_driven import EventDrivenBacktester # Import داخل تابع؛ موتور رویدادمحور فقط در این حالت لازم است
+
+        version = run.strategy_version
+        backtester = EventDrivenBacktester(
+            BacktestService.get_replay_dataset(run),
+            run.timeframe,
+            indicator_configs=version.indicator_configs,
+            price_action_configs=version.price_action_configs,
+            run_parameters=run.parameters,
+            runtime_config=run.runtime_config,
+            initial_capital=float(run.initial_capital) or 10_000.0,
+            position_size_mode=run.position_size_mode,
+            position_size_value=float(run.position_size_value),
+            trailing_stop_config=BacktestService.get_trailing_stop_config(run),
+        )
+        outcome = backtester.run()
+        metrics.observe('backtesting.event_driven.duration_ms', outcome.summary['duration_seconds'] * 1000)
+        if outcome.summary['events_per_second']:
+            metrics.observe('backtesting.event_driven.events_per_second', outcome.summary['events_per_second'])
+        return outcome
+
+    @staticmethod
+    def execute_run(run_id) -> BacktestRun:
+        """
+        Loads data, runs the engine and persists result_summary and per-fill BacktestResult rows.
+        The run is marked FAILED (with the error in result_summary) if anything raises.
+        """
+        run = BacktestRun.objects.select_related('strategy_version', 'instrument', 'exchange_account__exchange').get(id=run_id)
+        run.status = 'RUNNING'
+        run.started_at = timezone.now()
+        run.finished_at = None
+        run.save(update_fields=['status', 'started_at', 'finished_at', 'updated_at'])
+
+        try:
+            if run.runtime_config.get('engine', ENGINE_VECTORIZED) == ENGINE_EVENT_DRIVEN:
+                outcome = BacktestService.run_event_driven(run)
+            else:
+                coverage = BacktestService.check_data_coverage(run)
+                outcome = BacktestService.run_arrays(run, BacktestService.load_market_data(run))
+                if coverage is not None:
+                    outcome.summary['data_coverage'] = coverage
+            with transaction.atomic():
+                BacktestResult.objects.filter(backtest_run=run).delete()
+                BacktestResult.objects.bulk_create(
+                    BacktestService.build_result_rows(run, outcome),
+                    batch_size=BacktestService.RESULT_BATCH_SIZE,
+                )
+                run.result_summary = outcome.summary
+                run.status = 'COMPLETED'
+                run.finished_at = timezone.now()
+                run.save(update_fields=['result_summary', 'status', 'finished_at', 'updated_at'])
+            logger.info(
+                f"Backtest run {run.id} completed: {outcome.summary['bars']} bars, {outcome.trade_count} trades "
+                f"({outcome.summary.get('engine')}, {outcome.summary['duration_seconds']:.2f}s)."
+            )
+            return run
+        except Exception as e:
+            logger.error(f"Backtest run {run.id} failed: {str(e)}")
+            run.status = 'FAILED'
+            run.result_summary = {'error': str(e)}
+            run.finished_at = timezone.now()
+            run.save(update_fields=['result_summary', 'status', 'finished_at', 'updated_at'])
+            raise
+
+    @staticmethod
+    def build_result_rows(run: BacktestRun, outcome: BacktestOutcome) -> list:
+        """
+        Two BacktestResult rows per round trip: the entry fill and the exit fill (with P&L).
+        Event-driven outcomes store one row per (possibly partial) fill instead.
+        """
+        if outcome.fills is not None:
+            return [
+                BacktestResult(
+                    backtest_run=run,
+                    order_id=f"{run.id}-{fill.order_id}",
+                    trade_id=f"{run.id}-{fill.trade_no}",
+                    side=fill.side,
+                    quantity=Decimal(str(fill.quantity)),
+                    price=Decimal(str(round(fill.price, 8))),
+                    timestamp=from_epoch_ms(int(fill.timestamp)),
+                    pnl=Decimal(str(round(fill.pnl, 8))),
+                    exit_reason='' if fill.opening else fill.reason,
+                )
+                for fill in outcome.fills
+            ]
+        trades = outcome.trades
+        short = str(run.parameters.get('direction', '')).lower() == DIRECTION_SHORT
+        entry_side, exit_side = ('SELL', 'BUY') if short else ('BUY', 'SELL')
+        rows = []
+        for k in range(outcome.trade_count):
+            trade_id = f"{run.id}-{k + 1}"
+            quantity = Decimal(str(float(trades['quantity'][k])))
+            rows.append(BacktestResult(
+                backtest_run=run,
+                order_id=f"{trade_id}-entry",
+                trade_id=trade_id,
+                side=entry_side,
+                quantity=quantity,
+                price=Decimal(str(round(float(trades['entry_price'][k]), 8))),
+                timestamp=from_epoch_ms(int(trades['entry_timestamp'][k])),
+                pnl=Decimal('0'),
+            ))
+            rows.append(BacktestResult(
+                backtest_run=run,
+                order_id=f"{trade_id}-exit",
+                trade_id=trade_id,
+                side=exit_side,
+                quantity=quantity,
+                price=Decimal(str(round(float(trades['exit_price'][k]), 8))),
+                timestamp=from_epoch_ms(int(trades['exit_timestamp'][k])),
+                pnl=Decimal(str(round(float(trades['pnl'][k]), 8))),
+                exit_reason=trades['exit_reason'][k],
+            ))
+        return rows
+
+
+class ParameterSweepService:
+    """
+    Optimizes StrategyVersion.parameters_schema for a template BacktestRun (grid, random or
+    TPE-based Bayesian search, optional walk-forward) and stores a ranked table on that run.
+    """
+    MAX_RANKED_ROWS = 200
+
+    @staticmethod
+    def build_spec(run: BacktestRun) -> dict:
+        version = run.strategy_version
+        return {
+            'indicator_configs': version.indicator_configs,
+            'price_action_configs': version.price_action_configs,
+            'base_parameters': run.parameters,
+            'runtime_config': run.runtime_config,
+            'initial_capital': float(run.initial_capital) or 10_000.0,
+            'position_size_mode': run.position_size_mode,
+            'position_size_value': float(run.position_size_value),
+            'timeframe': run.timeframe,
+        }
+
+    @staticmethod
+    def run_sweep(base_run_id, method: str = SEARCH_GRID, n_iter: int = 100, objective: str = DEFAULT_OBJECTIVE,
+                  backend: str = BACKEND_PROCESS, max_workers: int = None, walk_forward: dict = None,
+                  early_stopping: dict = None, persist_top: int = 10, seed: int = None) -> dict:
+        """
+        walk_forward: {'train_days', 'test_days', 'step_days'}.
+        early_stopping: {'probe_fraction', 'min_return_pct', 'max_drawdown_pct'}.
+        With backend='celery' the sweep is only started (see start_celery_sweep) and None is returned.
+        """
+        options = {'method': method, 'n_iter': n_iter, 'objective': objective, 'max_workers': max_workers,
+                   'walk_forward': walk_forward, 'early_stopping': early_stopping, 'persist_top': persist_top, 'seed': seed}
+        if backend == BACKEND_CELERY:
+            ParameterSweepService.start_celery_sweep(base_run_id, **options)
+            return None
+
+        run = BacktestRun.objects.select_related('strategy_version', 'instrument', 'exchange_account__exchange').get(id=base_run_id)
+        space = ParameterSpace(run.strategy_version.parameters_schema)
+        ParameterSweepService._mark_running(run)
+
+        started = time.perf_counter()
+        shared = None
+        try:
+            arrays = BacktestService.load_market_data(run)
+            shared = SharedMarketData.create(arrays)
+            job_template = {'data_path': shared.path, 'spec': ParameterSweepService.build_spec(run), 'early_stopping': early_stopping}
+            windows = ParameterSweepService._windows(arrays, walk_forward)
+            with SweepExecutor(backend, max_workers) as executor:
+                report = run_steps(
+                    ParameterSweepService.sweep_steps(space, job_template, windows, method, n_iter, objective, seed,
+                                                      executor.max_workers),
+                    executor,
+                )
+        except Exception as e:
+            ParameterSweepService.mark_failed(run, e)
+            raise
+        finally:
+            if shared is not None:
+                shared.cleanup()
+
+        return ParameterSweepService._complete(run, space, report, method, objective, backend,
+                                               time.perf_counter() - started, persist_top)
+
+    @staticmethod
+    def sweep_steps(space, job_template, windows, method, n_iter, objective, seed, batch_size):
+        """
+        The whole sweep as a generator of job rounds (see optimization.search_steps); returns the report.
+        """
+        if windows is None:
+            ranked = yield from search_steps(space, job_template, method, n_iter, objective, seed, batch_size=batch_size)
+            return {
+                'ranked': ranked[:ParameterSweepService.MAX_RANKED_ROWS],
+                'evaluated': len(ranked),
+                'pruned': sum(1 for result in ranked if result.get('pruned')),
+            }
+
+        evaluated = pruned = 0
+        reports, by_params = [], {}
+        for window in windows:
+            ranked = yield from search_steps(
+                space, {**job_template, 'start_ms': window['train_start_ms'], 'end_ms': window['train_end_ms']},
+                method, n_iter, objective, seed, batch_size=batch_size,
+            )
+            evaluated += len(ranked)
+            pruned += sum(1 for result in ranked if result.get('pruned'))
+            best = ranked[0]
+            if best.get('pruned'):
+                reports.append({**window, 'best_parameters': None, 'in_sample': None, 'out_of_sample': None})
+                continue
+            test = (yield [{**job_template, 'early_stopping': None, 'parameters': best['parameters'],
+                            'start_ms': window['test_start_ms'], 'end_ms': window['test_end_ms']}])[0]
+            evaluated += 1
+            reports.append({**window, 'best_parameters': best['parameters'], 'in_sample': best['summary'], 'out_of_sample': test['summary']})
+            key = tuple(sorted(best['parameters'].items()))
+            by_params.setdefault(key, {'parameters': best['parameters'], 'windows': 0, 'oos_returns': []})
+            by_params[key]['windows'] += 1
+            by_params[key]['oos_returns'].append(test['summary'].get('total_return_pct') or 0.0)
+
+        oos_returns = [r['out_of_sample']['total_return_pct'] or 0.0 for r in reports if r['out_of_sample']]
+        compounded = float(np.prod([1 + value / 100 for value in oos_returns]) - 1) * 100 if oos_returns else 0.0
+        # جدول رتبه‌بندی: پارامترهای انتخاب‌شده بر اساس میانگین بازده خارج از نمونه
+        ranked = sorted(
+            ({'parameters': entry['parameters'], 'windows_selected': entry['windows'],
+              'summary': {'total_return_pct': float(np.mean(entry['oos_returns']))}, 'pruned': False}
+             for entry in by_params.values()),
+            key=lambda entry: entry['summary']['total_return_pct'],
+            reverse=True,
+        )
+        for rank, entry in enumerate(ranked, start=1):
+            entry['rank'] = rank
+        return {
+            'windows': reports,
+            'out_of_sample_return_pct': compounded,
+            'ranked': ranked,
+            'evaluated': evaluated,
+            'pruned': pruned,
+        }
+
+    # --- اجرای Celery: هر دور یک chord است و callback آن دور بعد را ارسال می‌کند ---
+    @staticmethod
+    def start_celery_sweep(base_run_id, method: str = SEARCH_GRID, n_iter: int = 100, objective: str = DEFAULT_OBJECTIVE,
+                           max_workers: int = None, walk_forward: dict = None, early_stopping: dict = None,
+                           persist_top: int = 10, seed: int = None):
+        """
+        Starts a sweep on Celery workers without blocking this worker. Progress (options and the
+        results of finished rounds) is kept in run.result_summary['sweep_progress']; workers load
+        the candles of the run themselves.
+        """
+        run = BacktestRun.objects.select_related('strategy_version', 'instrument', 'exchange_account__exchange').get(id=base_run_id)
+        ParameterSpace(run.strategy_version.parameters_schema) # اعتبارسنجی پیش از صف کردن
+        windows = None
+        if walk_forward:
+            windows = ParameterSweepService._windows(BacktestService.load_market_data(run), walk_forward)
+        ParameterSweepService._mark_running(run)
+        run.result_summary = {'sweep_progress': {
+            'options': {
+                'method': method, 'n_iter': n_iter, 'objective': objective, 'early_stopping': early_stopping,
+                'persist_top': persist_top, 'max_workers': max_workers or os.cpu_count() or 1,
+                # بذر ثابت لازم است تا بازپخش دورهای قبلی همان پیشنهادها را بدهد
+                'seed': seed if seed is not None else int(np.random.SeedSequence().entropy % (2 ** 32)),
+            },
+            'windows': windows,
+            'started_at': time.time(),
+            'rounds': [],
+        }}
+        run.save(update_fields=['result_summary', 'updated_at'])
+        ParameterSweepService.advance_celery_sweep(run)
+
+    @staticmethod
+    def advance_celery_sweep(run: BacktestRun, round_results: list = None):
+        """
+        Records the results of the finished round, then dispatches the next round as a chord
+        or completes the sweep.
+        """
+        from celery import chord # Import داخل تابع؛ فقط برای پخش روی کارگرهای Celery
+        from .tasks import continue_parameter_sweep_task, evaluate_parameter_batch_task, fail_parameter_sweep_task
+
+        progress = run.result_summary['sweep_progress']
+        if round_results is not None:
+            progress['rounds'].append(round_results)
+        options = progress['options']
+        space = ParameterSpace(run.strategy_version.parameters_schema)
+        job_template = {'run_id': str(run.id), 'spec': ParameterSweepService.build_spec(run),
+                        'early_stopping': options['early_stopping']}
+        steps = ParameterSweepService.sweep_steps(space, job_template, progress['windows'], options['method'],
+                                                  options['n_iter'], options['objective'], options['seed'],
+                                                  options['max_workers'])
+        try:
+            done, value = replay_steps(steps, progress['rounds'])
+        except Exception as e:
+            ParameterSweepService.mark_failed(run, e)
+            raise
+        if done:
+            return ParameterSweepService._complete(run, space, value, options['method'], options['objective'],
+                                                   BACKEND_CELERY, time.time() - progress['started_at'],
+                                                   options['persist_top'])
+
+        run.save(update_fields=['result_summary', 'updated_at'])
+        header = [evaluate_parameter_batch_task.s(batch) for batch in split_batches(value, options['max_workers'])]
+        chord(header)(continue_parameter_sweep_task.s(str(run.id)).on_error(fail_parameter_sweep_task.s(str(run.id))))
+        return None
+
+    @staticmethod
+    def _windows(arrays, walk_forward):
+        if not walk_forward:
+            return None
+        windows = walk_forward_windows(
+            arrays.timestamp,
+            float(walk_forward['train_days']),
+            float(walk_forward['test_days']),
+            walk_forward.get('step_days'),
+        )
+        if not windows:
+            raise BacktestConfigurationError("Data range is too short for the requested walk-forward windows.")
+        return windows
+
+    @staticmethod
+    def _mark_running(run: BacktestRun):
+        run.status = 'RUNNING'
+        run.started_at = timezone.now()
+        run.save(update_fields=['status', 'started_at', 'updated_at'])
+
+    @staticmethod
+    def mark_failed(run: BacktestRun, error):
+        logger.error(f"Parameter sweep for backtest run {run.id} failed: {str(error)}")
+        run.status = 'FAILED'
+        run.result_summary = {'error': str(error)}
+        run.finished_at = timezone.now()
+        run.save(update_fields=['result_summary', 'status', 'finished_at', 'updated_at'])
+
+    @staticmethod
+    def _complete(run: BacktestRun, space, report: dict, method, objective, backend, elapsed, persist_top) -> dict:
+        report.update({
+            'method': method,
+            'objective': objective,
+            'backend': backend,
+            'grid_size': space.grid_size(),
+            'duration_seconds': elapsed,
+            'backtests_per_hour': report['evaluated'] / elapsed * 3600 if elapsed > 0 else None,
+        })
+        metrics.incr('backtesting.sweep.backtests', report['evaluated'])
+
+        with transaction.atomic():
+            run.result_summary = {'sweep': report}
+            run.status = 'COMPLETED'
+            run.finished_at = timezone.now()
+            run.save(update_fields=['result_summary', 'status', 'finished_at', 'updated_at'])
+            if persist_top and report.get('ranked'):
+                ParameterSweepService.persist_top_runs(run, report['ranked'][:persist_top])
+        logger.info(f"Parameter sweep for run {run.id}: {report['evaluated']} backtests in {elapsed:.1f}s.")
+        return report
+
+    @staticmethod
+    def persist_top_runs(run: BacktestRun, ranked: list) -> list:
+        """
+        Stores the best parameter sets as completed child BacktestRuns (summary only).
+        """
+        now = timezone.now()
+        children = [
+            BacktestRun(
+                strategy_version=run.strategy_version,
+                owner=run.owner,
+                instrument=run.instrument,
+                exchange_account=run.exchange_account,
+                timeframe=run.timeframe,
+                start_datetime=run.start_datetime,
+                end_datetime=run.end_datetime,
+                initial_capital=run.initial_capital,
+                position_size_mode=run.position_size_mode,
+                position_size_value=run.position_size_value,
+                parameters={**run.parameters, **result['parameters']},
+                runtime_config={**run.runtime_config, 'sweep_parent_id': str(run.id)},
+                status='COMPLETED',
+                result_summary={**result['summary'], 'sweep_rank': result['rank']},
+                started_at=run.started_at,
+                finished_at=now,
+            )
+            for result in ranked
+        ]
+        return BacktestRun.objects.bulk_create(children)
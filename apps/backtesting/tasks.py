@@ -0,0 +1,88 @@
+# apps/backtesting/tasks.py
+
+import logging
+from celery import shared_task
+from .exceptions import BacktestConfigurationError, BacktestDataError
+from .models import BacktestRun
+from .services import BacktestService
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(bind=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 2, 'countdown': 30})
+def run_backtest_task(self, backtest_run_id):
+    """
+    Celery task that executes a BacktestRun (engine selected by runtime_config['engine']).
+    Configuration and missing-data errors are final and are not retried.
+    """
+    try:
+        run = BacktestService.execute_run(backtest_run_id)
+        return run.result_summary
+    except BacktestRun.DoesNotExist:
+        logger.error(f"BacktestRun with ID {backtest_run_id} not found.")
+        return None
+    except (BacktestConfigurationError, BacktestDataError) as e:
+        logger.warning(f"Backtest run {backtest_run_id} cannot be executed: {str(e)}")
+        return None
+    except Exception as e:
+        logger.error(f"Error executing backtest run {backtest_run_id}: {str(e)}")
+        raise # Celery retry
+
+
+@shared_task(bind=True)
+def run_parameter_sweep_task(self, backtest_run_id, options: dict = None):
+    """
+    Starts a parameter sweep / walk-forward optimization for a template BacktestRun.
+    Inside a Celery worker the backtests are fanned out to other workers as one chord per
+    round (prefork workers cannot start their own process pools and must not wait on subtasks).
+    """
+    from .optimization import BACKEND_CELERY # Import داخل تابع برای جلوگیری از حلقه
+    from .services import ParameterSweepService
+    options = {**(options or {}), 'backend': BACKEND_CELERY}
+    try:
+        return ParameterSweepService.run_sweep(backtest_run_id, **options)
+    except BacktestRun.DoesNotExist:
+        logger.error(f"BacktestRun with ID {backtest_run_id} not found for parameter sweep.")
+        return None
+    except (BacktestConfigurationError, BacktestDataError) as e:
+        logger.warning(f"Parameter sweep for run {backtest_run_id} cannot be executed: {str(e)}")
+        return None
+
+
+@shared_task
+def evaluate_parameter_batch_task(jobs: list):
+    """
+    Evaluates a batch of sweep jobs on this worker. Market data is loaded once per worker
+    process from the columnar store / DB for the run referenced by the jobs.
+    """
+    from .optimization import evaluate_parameter_set # Import داخل تابع برای جلوگیری از حلقه
+    return [evaluate_parameter_set(job) for job in jobs]
+
+
+@shared_task
+def continue_parameter_sweep_task(batch_results: list, backtest_run_id):
+    """
+    Chord callback of a sweep round: records the round's results and dispatches the next round.
+    """
+    from .services import ParameterSweepService # Import داخل تابع برای جلوگیری از حلقه
+    try:
+        run = BacktestRun.objects.select_related('strategy_version', 'instrument', 'exchange_account__exchange').get(id=backtest_run_id)
+    except BacktestRun.DoesNotExist:
+        logger.error(f"BacktestRun with ID {backtest_run_id} not found for parameter sweep.")
+        return None
+    if run.status != 'RUNNING' or 'sweep_progress' not in (run.result_summary or {}):
+        logger.warning(f"Parameter sweep for run {backtest_run_id} is no longer running; round result ignored.")
+        return None
+    ParameterSweepService.advance_celery_sweep(run, [result for batch in batch_results for result in batch])
+    return None
+
+
+@shared_task
+def fail_parameter_sweep_task(request, exc, traceback, backtest_run_id):
+    """
+    Chord error callback: marks the sweep as failed when a round cannot be evaluated.
+    """
+    from .services import ParameterSweepService # Import داخل تابع برای جلوگیری از حلقه
+    run = BacktestRun.objects.filter(id=backtest_run_id, status='RUNNING').first()
+    if run is not None:
+        ParameterSweepService.mark_failed(run, exc)
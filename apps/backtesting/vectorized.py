@@ -0,0 +1,402 @@
+# apps/backtesting/vectorized.py
+
+"""
+Vectorized backtest engine: every feature, signal and the bar-level equity curve is
+computed with array operations; only the (few) trades are iterated for position sizing.
+
+Strategy configuration (StrategyVersion JSON fields + BacktestRun.parameters):
+
+    indicator_configs:    [{"code": "EMA", "alias": "ema_fast", "params": {"period": "$fast"}}, ...]
+    price_action_configs: [{"code": "SUP_RES", "alias": "sr", "params": {"lookback": 20}}, ...]
+    parameters:           {"fast": 12, "direction": "long",
+                           "entry_conditions": [{"left": "ema_fast", "op": "crosses_above", "right": "ema_slow"}],
+                           "exit_conditions":  [{"left": "ema_fast", "op": "crosses_below", "right": "ema_slow"}]}
+
+Single-output indicators are exposed under their alias, multi-output ones as "alias.output"
+(e.g. "bb.upper"). "$name" strings are substituted from the run parameters. Signals are
+evaluated on bar close and filled on the next bar's open (no look-ahead).
+"""
+
+import logging
+import math
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from apps.instruments.exceptions import IndicatorValidationError
+from apps.instruments.indicator_engine import get_indicator_class
+from apps.market_data.resampling import timeframe_to_ms
+from apps.market_data.storage import OHLCVArrays
+from .exceptions import BacktestConfigurationError
+
+logger = logging.getLogger(__name__)
+
+PRICE_FEATURES = {
+    'open': 'open_price',
+    'high': 'high_price',
+    'low': 'low_price',
+    'close': 'close_price',
+    'volume': 'volume',
+}
+YEAR_MS = 365 * 86_400_000
+
+DIRECTION_LONG = 'long'
+DIRECTION_SHORT = 'short'
+
+EXIT_REASON_SIGNAL = 'signal'
+EXIT_REASON_END_OF_DATA = 'end_of_data'
+
+# --- رجیستری الگوهای پرایس‌اکشن (کدها مطابق PriceActionPattern.code) ---
+_PRICE_ACTION_CALCULATORS: Dict[str, Callable] = {}
+
+
+def register_price_action(*codes: str):
+    """
+    Decorator that registers a vectorized price-action feature function under PriceActionPattern codes.
+    The function receives OHLCVArrays plus params and returns {output_name: array}.
+    """
+    def decorator(func):
+        for code in codes:
+            _PRICE_ACTION_CALCULATORS[code.upper()] = func
+        return func
+    return decorator
+
+
+@register_price_action('SUP_RES', 'SUPPORT_RESISTANCE')
+def support_resistance(arrays: OHLCVArrays, lookback: int = 20) -> Dict[str, np.ndarray]:
+    """
+    Highest high / lowest low of the previous `lookback` bars (current bar excluded).
+    """
+    lookback = int(lookback)
+    resistance = pd.Series(arrays.high_price).rolling(lookback).max().shift(1).to_numpy()
+    support = pd.Series(arrays.low_price).rolling(lookback).min().shift(1).to_numpy()
+    return {'resistance': resistance, 'support': support}
+
+
+@register_price_action('ENGULFING')
+def engulfing(arrays: OHLCVArrays) -> Dict[str, np.ndarray]:
+    """
+    Bullish/bearish engulfing candles as 1.0/0.0 series.
+    """
+    o, c = arrays.open_price, arrays.close_price
+    prev_o, prev_c = np.roll(o, 1), np.roll(c, 1)
+    bullish = (prev_c < prev_o) & (c > o) & (o <= prev_c) & (c >= prev_o)
+    bearish = (prev_c > prev_o) & (c < o) & (o >= prev_c) & (c <= prev_o)
+    if len(o):
+        bullish[0] = bearish[0] = False
+    return {'bullish': bullish.astype(np.float64), 'bearish': bearish.astype(np.float64)}
+
+
+# --- پارامترها و ویژگی‌ها ---
+
+def resolve_parameter(value: Any, run_parameters: Dict[str, Any]) -> Any:
+    if isinstance(value, str) and value.startswith('$'):
+        name = value[1:]
+        if name not in run_parameters:
+            raise BacktestConfigurationError(f"Parameter '{name}' referenced by the strategy is missing from the run parameters.")
+        return run_parameters[name]
+    return value
+
+
+def resolve_parameters(params: Optional[Dict[str, Any]], run_parameters: Dict[str, Any]) -> Dict[str, Any]:
+    return {name: resolve_parameter(value, run_parameters) for name, value in (params or {}).items()}
+
+
+def _add_outputs(features: Dict[str, np.ndarray], alias: str, outputs: Dict[str, np.ndarray]):
+    for name, series in outputs.items():
+        key = alias if name == 'value' or len(outputs) == 1 else f"{alias}.{name}"
+        features[key] = np.asarray(series, dtype=np.float64)
+
+
+def build_features(arrays: OHLCVArrays, indicator_configs: Optional[List[Dict]] = None,
+                   price_action_configs: Optional[List[Dict]] = None,
+                   run_parameters: Optional[Dict[str, Any]] = None) -> Dict[str, np.ndarray]:
+    """
+    Computes price columns, indicator outputs (vectorized warm-up of the streaming
+    implementations) and price-action features as named arrays aligned with `arrays`.
+    """
+    run_parameters = run_parameters or {}
+    features = {name: getattr(arrays, column) for name, column in PRICE_FEATURES.items()}
+
+    for config in indicator_configs or []:
+        code = config.get('code')
+        if not code:
+            raise BacktestConfigurationError(f"Indicator config without 'code': {config}")
+        try:
+            indicator = get_indicator_class(code)(**resolve_parameters(config.get('params'), run_parameters))
+            outputs = indicator.warm_up(arrays)
+        except IndicatorValidationError as e:
+            raise BacktestConfigurationError(str(e))
+        _add_outputs(features, config.get('alias') or code.lower(), outputs)
+
+    for config in price_action_configs or []:
+        code = (config.get('code') or '').upper()
+        calculator = _PRICE_ACTION_CALCULATORS.get(code)
+        if calculator is None:
+            raise BacktestConfigurationError(f"No vectorized implementation registered for price action pattern '{code}'.")
+        _add_outputs(features, config.get('alias') or code.lower(), calculator(arrays, **resolve_parameters(config.get('params'), run_parameters)))
+
+    return features
+
+
+# --- شرط‌ها و سیگنال‌ها ---
+
+def _operand(value: Any, features: Dict[str, np.ndarray], run_parameters: Dict[str, Any]):
+    value = resolve_parameter(value, run_parameters)
+    if isinstance(value, str):
+        if value not in features:
+            raise BacktestConfigurationError(f"Unknown series '{value}' in condition. Available: {sorted(features)}")
+        return features[value]
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise BacktestConfigurationError(f"Invalid condition operand: {value!r}")
+
+
+def _previous(values):
+    if np.isscalar(values):
+        return values
+    shifted = np.empty_like(values)
+    shifted[1:] = values[:-1]
+    if len(shifted):
+        shifted[0] = np.nan
+    return shifted
+
+
+_COMPARISONS = {
+    '>': np.greater,
+    '<': np.less,
+    '>=': np.greater_equal,
+    '<=': np.less_equal,
+    '==': np.equal,
+}
+
+
+def evaluate_conditions(features: Dict[str, np.ndarray], conditions: Optional[List[Dict]],
+                        run_parameters: Optional[Dict[str, Any]] = None, length: Optional[int] = None) -> np.ndarray:
+    """
+    ANDs a list of {'left', 'op', 'right'} conditions into one boolean array.
+    Comparisons against NaN (indicator warm-up) are False. An empty list never fires.
+    """
+    run_parameters = run_parameters or {}
+    length = len(features['close']) if length is None else length
+    if not conditions:
+        return np.zeros(length, dtype=bool)
+
+    result = np.ones(length, dtype=bool)
+    with np.errstate(invalid='ignore'):
+        for condition in conditions:
+            left = _operand(condition.get('left'), features, run_parameters)
+            right = _operand(condition.get('right'), features, run_parameters)
+            op = condition.get('op')
+            if op in _COMPARISONS:
+                result &= _COMPARISONS[op](left, right)
+            elif op == 'crosses_above':
+                result &= (np.greater(left, right) & np.less_equal(_previous(left), _previous(right)))
+            elif op == 'crosses_below':
+                result &= (np.less(left, right) & np.greater_equal(_previous(left), _previous(right)))
+            else:
+                raise BacktestConfigurationError(f"Unsupported condition operator '{op}'.")
+    return result
+
+
+def target_position(entries: np.ndarray, exits: np.ndarray) -> np.ndarray:
+    """
+    Desired position after each bar close: in the market if the latest entry signal is
+    more recent than the latest exit signal (an exit on the same bar wins).
+    """
+    index = np.arange(len(entries))
+    last_entry = np.maximum.accumulate(np.where(entries, index, -1)) if len(index) else index
+    last_exit = np.maximum.accumulate(np.where(exits, index, -1)) if len(index) else index
+    return last_entry > last_exit
+
+
+# --- نتیجه ---
+
+class BacktestOutcome:
+    """
+    Trades (dict of equally long arrays), the bar-level equity curve and the summary metrics.
+    """
+    __slots__ = ('trades', 'equity', 'summary', 'fills')
+
+    def __init__(self, trades: Dict[str, np.ndarray], equity: np.ndarray, summary: Dict[str, Any], fills: Optional[list] = None):
+        self.trades = trades
+        self.equity = equity
+        self.summary = summary
+        self.fills = fills # فقط در حالت رویدادمحور: رکورد تک‌تک fillها
+
+    @property
+    def trade_count(self) -> int:
+        return len(self.trades['entry_index'])
+
+
+def get_cost_settings(runtime_config: Optional[Dict[str, Any]]) -> Dict[str, float]:
+    """
+    Commission and slippage as fractions of notional. Accepts 'commission'/'slippage'
+    fractions or '*_bps' basis points in BacktestRun.runtime_config.
+    """
+    runtime_config = runtime_config or {}
+    commission = runtime_config.get('commission')
+    if commission is None:
+        commission = float(runtime_config.get('commission_bps', 0)) / 10_000
+    slippage = runtime_config.get('slippage')
+    if slippage is None:
+        slippage = float(runtime_config.get('slippage_bps', 0)) / 10_000
+    return {'commission': float(commission), 'slippage': float(slippage)}
+
+
+def trade_notional(equity: float, price_risk: Optional[float], mode: str, value: float) -> float:
+    if mode == 'fixed':
+        return min(value, equity) if value > 0 else equity
+    if mode == 'risk_pct' and price_risk:
+        return equity * (value / 100) / price_risk
+    # percent (و risk_pct بدون حد ضرر)
+    return equity * (value / 100 if value > 0 else 1.0)
+
+
+def simulate(arrays: OHLCVArrays, target: np.ndarray, direction: str = DIRECTION_LONG,
+             runtime_config: Optional[Dict[str, Any]] = None, initial_capital: float = 10_000.0,
+             position_size_mode: str = 'percent', position_size_value: float = 100.0,
+             timeframe: Optional[str] = None) -> BacktestOutcome:
+    """
+    Fills target-position changes at the next bar's open with slippage and commission.
+    A position still open after the last bar is closed at the last close.
+    """
+    costs = get_cost_settings(runtime_config)
+    commission, slippage = costs['commission'], costs['slippage']
+    stop_loss_pct = float((runtime_config or {}).get('stop_loss_pct', 0)) / 100
+    sign = -1.0 if direction == DIRECTION_SHORT else 1.0
+    n = len(arrays)
+    initial_capital = float(initial_capital)
+
+    # پوزیشن نگهداری‌شده در طول کندل i همان هدف کندل i-1 است (پر شدن روی open کندل بعد)
+    held = np.zeros(n, dtype=np.int8)
+    if n > 1:
+        held[1:] = target[:-1]
+    changes = np.diff(held, prepend=np.int8(0))
+    entry_index = np.flatnonzero(changes == 1)
+    exit_index = np.flatnonzero(changes == -1)
+    open_at_end = len(exit_index) < len(entry_index)
+
+    entry_price = arrays.open_price[entry_index] * (1 + sign * slippage)
+    exit_price = np.empty(len(entry_index))
+    exit_price[:len(exit_index)] = arrays.open_price[exit_index] * (1 - sign * slippage)
+    if open_at_end:
+        exit_price[-1] = arrays.close_price[-1] * (1 - sign * slippage)
+        exit_index = np.append(exit_index, n) # نگهداری تا آخرین کندل
+
+    # اندازه پوزیشن به equity وابسته است؛ فقط روی معاملات (نه کندل‌ها) پیمایش می‌شود
+    count = len(entry_index)
+    quantity = np.empty(count)
+    pnl = np.empty(count)
+    fees = np.empty(count)
+    equity_before = np.empty(count)
+    equity = initial_capital
+    for k in range(count):
+        equity_before[k] = equity
+        notional = trade_notional(equity, stop_loss_pct or None, position_size_mode, float(position_size_value))
+        quantity[k] = max(notional, 0.0) / entry_price[k]
+        fees[k] = commission * quantity[k] * (entry_price[k] + exit_price[k])
+        pnl[k] = sign * quantity[k] * (exit_price[k] - entry_price[k]) - fees[k]
+        equity += pnl[k]
+    equity_after = equity_before + pnl
+
+    equity_curve = _equity_curve(arrays, entry_index, exit_index, entry_price, quantity,
+                                 equity_before, equity_after, commission, sign, initial_capital)
+
+    timestamps = arrays.timestamp
+    exit_ts = np.where(exit_index < n, timestamps[np.minimum(exit_index, n - 1)], timestamps[-1] if n else 0)
+    exit_reason = np.full(count, EXIT_REASON_SIGNAL, dtype=object)
+    if open_at_end:
+        exit_reason[-1] = EXIT_REASON_END_OF_DATA
+    trades = {
+        'entry_index': entry_index,
+        'exit_index': np.minimum(exit_index, n - 1),
+        'entry_timestamp': timestamps[entry_index],
+        'exit_timestamp': exit_ts,
+        'entry_price': entry_price,
+        'exit_price': exit_price,
+        'quantity': quantity,
+        'pnl': pnl,
+        'commission': fees,
+        'exit_reason': exit_reason,
+    }
+    summary = summarize(equity_curve, trades, held, initial_capital, timeframe)
+    return BacktestOutcome(trades, equity_curve, summary)
+
+
+def _equity_curve(arrays, entry_index, exit_index, entry_price, quantity, equity_before, equity_after,
+                  commission, sign, initial_capital) -> np.ndarray:
+    """
+    Mark-to-market equity at each bar close, computed without a per-bar loop.
+    """
+    n = len(arrays)
+    equity = np.full(n, initial_capital, dtype=np.float64)
+    if not len(entry_index) or not n:
+        return equity
+    bars = np.arange(n)
+    trade = np.searchsorted(entry_index, bars, side='right') - 1
+    started = trade >= 0
+    k = np.where(started, trade, 0)
+    holding = started & (bars < exit_index[k])
+    closed = started & ~holding
+
+    entry_fee = commission * quantity * entry_price
+    unrealized = equity_before[k] - entry_fee[k] + sign * quantity[k] * (arrays.close_price - entry_price[k])
+    equity = np.where(holding, unrealized, equity)
+    equity = np.where(closed, equity_after[k], equity)
+    if exit_index[-1] >= n: # پوزیشن باز در پایان داده روی آخرین close بسته می‌شود
+        equity[-1] = equity_after[-1]
+    return equity
+
+
+def summarize(equity: np.ndarray, trades: Dict[str, np.ndarray], held: np.ndarray,
+              initial_capital: float, timeframe: Optional[str] = None) -> Dict[str, Any]:
+    final_equity = float(equity[-1]) if len(equity) else initial_capital
+    running_max = np.maximum.accumulate(equity) if len(equity) else equity
+    drawdown = (equity - running_max) / np.where(running_max > 0, running_max, 1.0) if len(equity) else equity
+    pnl = trades['pnl']
+    wins, losses = pnl[pnl > 0], pnl[pnl <= 0]
+
+    sharpe = None
+    if len(equity) > 2 and timeframe:
+        returns = np.diff(equity) / np.where(equity[:-1] != 0, equity[:-1], 1.0)
+        std = returns.std()
+        if std > 0:
+            sharpe = float(returns.mean() / std * math.sqrt(YEAR_MS / timeframe_to_ms(timeframe)))
+
+    gross_loss = float(-losses.sum())
+    return {
+        'initial_capital': initial_capital,
+        'final_equity': final_equity,
+        'net_profit': final_equity - initial_capital,
+        'total_return_pct': (final_equity / initial_capital - 1) * 100 if initial_capital else 0.0,
+        'max_drawdown_pct': float(-drawdown.min() * 100) if len(drawdown) else 0.0,
+        'sharpe_ratio': sharpe,
+        'num_trades': int(len(pnl)),
+        'win_rate_pct': float(len(wins) / len(pnl) * 100) if len(pnl) else 0.0,
+        'profit_factor': float(wins.sum() / gross_loss) if gross_loss > 0 else None,
+        'avg_trade_pnl': float(pnl.mean()) if len(pnl) else 0.0,
+        'total_commission': float(trades['commission'].sum()),
+        'exposure_pct': float(held.mean() * 100) if len(held) else 0.0,
+        'bars': int(len(equity)),
+    }
+
+
+def run_vectorized_backtest(arrays: OHLCVArrays, indicator_configs: Optional[List[Dict]] = None,
+                            price_action_configs: Optional[List[Dict]] = None,
+                            run_parameters: Optional[Dict[str, Any]] = None, **simulation_kwargs) -> BacktestOutcome:
+    """
+    Full pipeline on in-memory arrays: features -> entry/exit signals -> fills -> metrics.
+    `simulation_kwargs` are passed to simulate() (runtime_config, initial_capital, sizing, timeframe).
+    """
+    run_parameters = run_parameters or {}
+    direction = str(run_parameters.get('direction', DIRECTION_LONG)).lower()
+    if direction not in (DIRECTION_LONG, DIRECTION_SHORT):
+        raise BacktestConfigurationError(f"Unsupported direction '{direction}'.")
+
+    features = build_features(arrays, indicator_configs, price_action_configs, run_parameters)
+    entries = evaluate_conditions(features, run_parameters.get('entry_conditions'), run_parameters, len(arrays))
+    exits = evaluate_conditions(features, run_parameters.get('exit_conditions'), run_parameters, len(arrays))
+    return simulate(arrays, target_position(entries, exits), direction=direction, **simulation_kwargs)
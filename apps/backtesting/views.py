@@ -1,7 +1,10 @@
 # apps/backtesting/views.py
-from rest_framework import viewsets, permissions
+from rest_framework import viewsets, permissions, status
+from rest_framework.decorators import action
+from rest_framework.response import Response
 from .models import BacktestRun, BacktestResult
-from .serializers import BacktestRunSerializer, BacktestResultSerializer
+from .serializers import BacktestRunSerializer, BacktestResultSerializer, ParameterSweepOptionsSerializer
+from .tasks import run_backtest_task, run_parameter_sweep_task
 from apps.core.views import SecureModelViewSet
 
 
@@ -9,8 +12,31 @@ class BacktestRunViewSet(SecureModelViewSet):
     queryset = BacktestRun.objects.all()  # اضافه شد
     serializer_class = BacktestRunSerializer
 
+    @action(detail=True, methods=['post'])
+    def run(self, request, pk=None):
+        """صف کردن اجرای بک‌تست"""
+        backtest_run = self.get_object()
+        if backtest_run.status == 'RUNNING':
+            return Response({"error": "Backtest is already running"}, status=status.HTTP_409_CONFLICT)
+        backtest_run.status = 'PENDING'
+        backtest_run.save(update_fields=['status', 'updated_at'])
+        run_backtest_task.delay(str(backtest_run.id))
+        return Response({"status": "queued"}, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=True, methods=['post'])
+    def sweep(self, request, pk=None):
+        """بهینه‌سازی پارامترها (grid/random/bayesian و walk-forward) با این اجرا به عنوان الگو"""
+        backtest_run = self.get_object()
+        if backtest_run.status == 'RUNNING':
+            return Response({"error": "Backtest is already running"}, status=status.HTTP_409_CONFLICT)
+        serializer = ParameterSweepOptionsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        options = {key: (dict(value) if isinstance(value, dict) else value) for key, value in serializer.validated_data.items()}
+        run_parameter_sweep_task.delay(str(backtest_run.id), options)
+        return Response({"status": "queued"}, status=status.HTTP_202_ACCEPTED)
+
 
 class BacktestResultViewSet(viewsets.ModelViewSet):  # بدون owner
     queryset = BacktestResult.objects.all()
     serializer_class = BacktestResultSerializer
-    permission_classes = [permissions.IsAuthenticated]
\ No newline at end of file
+    permission_classes = [permissions.IsAuthenticated]
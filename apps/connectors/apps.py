@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class ConnectorsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.connectors'
+
+    def ready(self):
+        # سیگنال‌های باطل‌سازی استخر کانکتورها
+        import apps.connectors.signals  # noqa F401
@@ -1,12 +1,14 @@
 # apps/connectors/base.py
-import time
 import asyncio
 import logging
+import time
 from abc import ABC, abstractmethod
 from decimal import Decimal
 from django.conf import settings
 from django.utils import timezone
-from .models import ConnectorLog, RateLimitState, ConnectorSession, ConnectorHealthCheck
+from .models import ConnectorLog, ConnectorSession, ConnectorHealthCheck, ExchangeConnectorConfig
+from .rate_limiter import rate_limiter
+from .transport import HttpResponse, get_http_transport, http_request_sync
 from apps.exchanges.models import ExchangeAccount
 from apps.logging_app.models import SystemLog # برای لاگ امنیتی
 import hashlib
@@ -21,6 +23,8 @@ class ExchangeConnector(ABC):
     """
     کلاس پایه یکپارچه برای تمام کانکتورهای صرافی.
     """
+    # آدرس پایه REST؛ زیرکلاس‌ها مقداردهی می‌کنند
+    api_base_url = None
     def __init__(self, api_key: str, api_secret: str, exchange_account_id: int, **kwargs):
         """
         سازنده کلاس برای ذخیره کلیدهای API و اطلاعات حساب.
@@ -28,11 +32,13 @@ class ExchangeConnector(ABC):
         self.api_key = api_key
         self.api_secret = api_secret
         self.exchange_account_id = exchange_account_id
-        self.exchange_account = ExchangeAccount.objects.get(id=exchange_account_id)
+        # حسابی که فراخواننده (مثلاً استخر کانکتورها) از قبل خوانده دوباره از دیتابیس خوانده نمی‌شود
+        self.exchange_account = kwargs.get('exchange_account') or ExchangeAccount.objects.select_related('exchange').get(id=exchange_account_id)
         self.client = None
         self.session = None
         self.ws_connection = None
         self._rate_limit_lock = asyncio.Lock()
+        self._rate_limits = None
 
     def _log_interaction(self, action: str, endpoint: str, request_payload: dict, response_payload: dict, status_code: int = None, error_message: str = ""):
         """
@@ -53,59 +59,62 @@ class ExchangeConnector(ABC):
             trace_id=trace_id,
         )
 
-    def _check_rate_limit(self, endpoint_path: str) -> bool:
-        """
-        چک کردن محدودیت درخواست.
-        """
-        now = timezone.now()
-        window_start = now.replace(minute=0, second=0, microsecond=0) # 1-minute window
-
-        rate_limit_state, created = RateLimitState.objects.get_or_create(
-            exchange_account=self.exchange_account,
-            endpoint_path=endpoint_path,
-            window_start_at=window_start,
-            defaults={'requests_count': 0, 'is_rate_limited': False}
+    def _rate_limit_buckets(self, endpoint_path: str, method: str = None):
+        """
+        باکت‌های توکن یک درخواست (وزن IP صرافی + حساب/endpoint).
+        """
+        if self._rate_limits is None:
+            exchange = self.exchange_account.exchange
+            try:
+                ip_weight_per_minute = exchange.connector_config.rate_limit_per_minute
+            except ExchangeConnectorConfig.DoesNotExist:
+                ip_weight_per_minute = 1200 # مقدار پیش‌فرض مدل
+            # محدودیت‌ها یک بار برای هر نمونه کانکتور خوانده می‌شوند
+            self._rate_limits = (exchange.id, ip_weight_per_minute, exchange.rate_limit_per_second)
+        exchange_id, ip_weight_per_minute, account_requests_per_second = self._rate_limits
+        weight = rate_limiter.get_endpoint_weight(exchange_id, endpoint_path, method)
+        return rate_limiter.bucket_specs(
+            exchange_id, self.exchange_account_id, endpoint_path, weight,
+            ip_weight_per_minute, account_requests_per_second,
         )
 
-        # به روزرسانی وضعیت قبلی
-        if rate_limit_state.window_start_at < now:
-            # اگر زمان پنجره گذشته باشد، مقدار جدید بساز
-            rate_limit_state.delete()
-            rate_limit_state = RateLimitState.objects.create(
-                exchange_account=self.exchange_account,
-                endpoint_path=endpoint_path,
-                window_start_at=window_start,
-                requests_count=0,
-                is_rate_limited=False
-            )
+    def _check_rate_limit(self, endpoint_path: str, method: str = None) -> bool:
+        """
+        چک کردن محدودیت درخواست (بدون دسترسی به دیتابیس؛ وضعیت در rate_limiter نگهداری می‌شود).
+        """
+        return rate_limiter.try_acquire(self._rate_limit_buckets(endpoint_path, method)) <= 0
 
-        # پیدا کردن endpoint از مدل
-        from .models import ExchangeAPIEndpoint
-        try:
-            api_endpoint = ExchangeAPIEndpoint.objects.get(exchange=self.exchange_account.exchange, endpoint_path=endpoint_path)
-            weight = api_endpoint.rate_limit_weight
-        except ExchangeAPIEndpoint.DoesNotExist:
-            weight = 1 # وزن پیش‌فرض
+    def _handle_rate_limit_wait(self, endpoint_path: str, method: str = None, timeout: float = None) -> bool:
+        """
+        اگر محدودیت شد، دقیقاً تا بازیابی توکن‌ها صبر کن.
+        """
+        return rate_limiter.acquire(self._rate_limit_buckets(endpoint_path, method), timeout=timeout)
 
-        # چک کردن محدودیت
-        config = self.exchange_account.exchange.connector_config
-        if rate_limit_state.requests_count + weight > config.rate_limit_per_minute:
-            rate_limit_state.is_rate_limited = True
-            rate_limit_state.retry_after = now + timezone.timedelta(minutes=1)
-            rate_limit_state.save()
-            return False
+    async def _handle_rate_limit_wait_async(self, endpoint_path: str, method: str = None, timeout: float = None) -> bool:
+        """
+        نسخه async انتظار برای محدودیت درخواست.
+        """
+        return await rate_limiter.acquire_async(self._rate_limit_buckets(endpoint_path, method), timeout=timeout)
 
-        # افزایش تعداد درخواست
-        rate_limit_state.requests_count += weight
-        rate_limit_state.save()
-        return True
+    def _rest_request(self, method: str, endpoint_path: str, **kwargs) -> HttpResponse:
+        """
+        REST call on the shared connection pool, charged to this account's rate-limit buckets.
+        kwargs are HttpTransport.request() options (params, data, idempotency_key, prepare, ...).
+        """
+        return http_request_sync(
+            method, f"{self.api_base_url}{endpoint_path}",
+            rate_limit=self._rate_limit_buckets(endpoint_path, method.upper()), **kwargs
+        )
 
-    def _handle_rate_limit_wait(self, endpoint_path: str):
+    async def _rest_request_async(self, method: str, endpoint_path: str, **kwargs) -> HttpResponse:
         """
-        اگر محدودیت شد، صبر کن.
+        Async _rest_request() on the running loop's pool.
         """
-        while not self._check_rate_limit(endpoint_path):
-            time.sleep(1)
+        # خواندن محدودیت‌ها/وزن‌ها ممکن است به دیتابیس برود؛ پس بیرون از حلقه رویداد
+        buckets = await asyncio.to_thread(self._rate_limit_buckets, endpoint_path, method.upper())
+        return await get_http_transport().request(
+            method, f"{self.api_base_url}{endpoint_path}", rate_limit=buckets, **kwargs
+        )
 
     def _sign_request(self, message: str) -> str:
         """
@@ -172,9 +181,10 @@ class ExchangeConnector(ABC):
         """
         try:
             # یک درخواست سبک برای چک کردن اتصال
+            started = time.perf_counter()
             account_info = self.get_balance()
             is_healthy = bool(account_info)
-            latency = 0 # محاسبه تأخیر
+            latency = round((time.perf_counter() - started) * 1000, 3)
             ConnectorHealthCheck.objects.create(
                 exchange_account=self.exchange_account,
                 is_healthy=is_healthy,
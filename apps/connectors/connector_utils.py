@@ -1,28 +1,23 @@
 # apps/bots/connector_utils.py
-from .base import ExchangeConnector
-from apps.connectors.binance_connector import BinanceConnector
-from apps.connectors.registry import get_connector
+from apps.connectors.pool import connector_pool
 
 
-def get_bot_connector(bot_instance):
+def get_account_connector(exchange_account):
     """
-    یک تابع کمکی برای دریافت کانکتور اتصال‌دهنده صحیح برای یک بات.
+    Connected connector of an exchange account from the process-wide pool (None if it cannot connect).
     """
-    exchange_account = bot_instance.exchange_account
-    connector_class = get_connector(exchange_code=exchange_account.exchange.code)
-    if not connector_class:
-        raise ValueError(f"Unsupported exchange: {exchange_account.exchange.code}")
+    return connector_pool.get(exchange_account)
 
-    # ایجاد نمونه از کلاس اتصال‌دهنده با کلیدهای API رمزنگاری شده
-    connector = connector_class(
-        api_key=exchange_account.api_key_encrypted,
-        api_secret=exchange_account.api_secret_encrypted
-    )
 
-    # اتصال به صرافی
-    if connector.connect():
-        return connector
-    else:
-        return None
+def evict_account_connector(exchange_account_id):
+    """
+    Drops (and disconnects) the pooled connector of an account.
+    """
+    return connector_pool.invalidate(exchange_account_id)
 
 
+def get_bot_connector(bot_instance):
+    """
+    یک تابع کمکی برای دریافت کانکتور اتصال‌دهنده صحیح برای یک بات.
+    """
+    return get_account_connector(bot_instance.exchange_account)
@@ -167,7 +167,6 @@
 
 # apps/connectors/exchange_lbank_connector.py
 from .connector_interface import IExchangeConnector
-import aiohttp
 import asyncio
 import hashlib
 import hmac
@@ -184,7 +183,7 @@ class LBankConnector(IExchangeConnector):
         self.ws_url = config.data_source.ws_url
         self.api_key = credential.api_key_encrypted  # فرض می‌کنیم که از مدل APICredential بگیرد
         self.api_secret = credential.api_secret_encrypted
-        self.session = aiohttp.ClientSession()
+        # REST از transport مشترک (apps.connectors.transport.get_http_transport) استفاده می‌کند
         self.is_connected = False
 
     async def connect(self):
@@ -194,8 +193,7 @@ class LBankConnector(IExchangeConnector):
         pass
 
     async def disconnect(self):
-        if self.session:
-            await self.session.close()
+        # جلسه HTTP مشترک است و اینجا بسته نمی‌شود
         self.is_connected = False
 
     def _sign_message(self, params: dict) -> str:
@@ -65,7 +65,6 @@
 
 # apps/connectors/exchange_nobitex_connector.py
 from .connector_interface import IExchangeConnector
-import aiohttp
 import asyncio
 import json
 
@@ -77,11 +76,11 @@ class NobitexConnector(IExchangeConnector):
         self.agent = agent
         self.ws_url = config.data_source.ws_url
         self.token = credential.api_key_encrypted  # در Nobitex ممکن است JWT Token باشد
-        self.session = aiohttp.ClientSession()
-        self.session.headers.update({
+        # هدرهای هر درخواست REST روی transport مشترک (apps.connectors.transport.get_http_transport)
+        self.headers = {
             'Authorization': f'Bearer {self.token}',
             'Content-Type': 'application/json',
-        })
+        }
         self.is_connected = False
 
     async def connect(self):
@@ -91,8 +90,7 @@ class NobitexConnector(IExchangeConnector):
         pass
 
     async def disconnect(self):
-        if self.session:
-            await self.session.close()
+        # جلسه HTTP مشترک است و اینجا بسته نمی‌شود
         self.is_connected = False
 
     async def listen(self):
@@ -0,0 +1,301 @@
+# apps/connectors/pool.py
+
+"""
+Process-wide pool of connected ExchangeConnectors keyed by ExchangeAccount.
+
+A connector is created (keys decrypted, connect() round trip) the first time an account needs
+one and reused afterwards: a hit is a dict lookup under a lock. The pool is bounded by
+max_connections and evicts the least recently used connector when full. Credentials are
+refreshed by dropping the pooled connector:
+  - in this process, from APICredential / ExchangeAccount signals (apps.connectors.signals),
+  - across processes, by the maintenance thread comparing credential fingerprints,
+  - immediately, when a caller passes an ExchangeAccount whose keys differ from the pooled one.
+The maintenance thread also health-checks connectors idle for longer than idle_check_seconds
+(ConnectorHealthCheck rows), drops unhealthy ones and closes those unused for max_idle_seconds.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+from django.conf import settings
+
+from apps.core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+METRIC_PREFIX = 'connectors.pool'
+
+# تنظیمات پیش‌فرض؛ settings.CONNECTOR_POOL آن‌ها را بازنویسی می‌کند
+DEFAULT_CONNECTOR_POOL = {
+    'max_connections': 200,
+    'idle_check_seconds': 300,          # کانکتورهای بیکارتر از این بررسی سلامت می‌شوند
+    'max_idle_seconds': 3600,           # کانکتورهای بیکارتر از این بسته می‌شوند
+    'maintenance_interval_seconds': 60,
+}
+
+
+def get_connector_pool_settings() -> Dict[str, Any]:
+    merged = dict(DEFAULT_CONNECTOR_POOL)
+    merged.update(getattr(settings, 'CONNECTOR_POOL', {}) or {})
+    return merged
+
+
+def credentials_fingerprint(exchange_account) -> tuple:
+    """
+    Cheap identity of an account's keys (ciphertexts, no decryption).
+    """
+    return (
+        exchange_account.exchange_id,
+        exchange_account._api_key_encrypted,
+        exchange_account._api_secret_encrypted,
+        exchange_account.encrypted_key_iv,
+    )
+
+
+def load_exchange_account(exchange_account_id):
+    from apps.exchanges.models import ExchangeAccount # Import داخل تابع برای جلوگیری از حلقه
+    return ExchangeAccount.objects.select_related('exchange').get(id=exchange_account_id)
+
+
+def create_connector(exchange_account):
+    """
+    New connected trading connector of an account; None if connect() fails.
+    """
+    from .base import ExchangeConnector # Import داخل تابع برای جلوگیری از حلقه
+    from .registry import get_connector
+
+    connector_class = get_connector(exchange_account.exchange.code)
+    if not connector_class or not issubclass(connector_class, ExchangeConnector):
+        raise ValueError(f"Unsupported exchange: {exchange_account.exchange.code}")
+    # ایجاد نمونه از کلاس اتصال‌دهنده با کلیدهای API رمزگشایی‌شده (بدون خواندن دوباره حساب)
+    connector = connector_class(
+        api_key=exchange_account.api_key,
+        api_secret=exchange_account.api_secret,
+        exchange_account_id=exchange_account.id,
+        exchange_account=exchange_account,
+    )
+    return connector if connector.connect() else None
+
+
+class PooledConnector:
+    __slots__ = ('connector', 'fingerprint', 'created_at', 'last_used_at', 'last_checked_at')
+
+    def __init__(self, connector, fingerprint: tuple, now: float):
+        self.connector = connector
+        self.fingerprint = fingerprint
+        self.created_at = now
+        self.last_used_at = now
+        self.last_checked_at = now
+
+
+class ConnectorPool:
+    """
+    LRU pool of connected connectors, one per exchange account.
+    """
+
+    def __init__(self, options: Optional[Dict[str, Any]] = None, factory: Callable = create_connector,
+                 account_loader: Callable = load_exchange_account, clock: Callable = time.monotonic,
+                 start_maintenance: bool = True):
+        self._options = options
+        self._factory = factory
+        self._account_loader = account_loader
+        self._clock = clock
+        self._start_maintenance = start_maintenance
+        self._entries: 'OrderedDict[str, PooledConnector]' = OrderedDict()
+        self._lock = threading.Lock()
+        # یک قفل برای هر حساب در حال ساخت؛ درخواست‌های همزمان یک حساب فقط یک connect() می‌سازند
+        self._creating: Dict[str, threading.Lock] = {}
+        self._maintenance_thread: Optional[threading.Thread] = None
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'refreshes': 0, 'unhealthy': 0}
+
+    @property
+    def options(self) -> Dict[str, Any]:
+        if self._options is None:
+            self._options = get_connector_pool_settings()
+        return self._options
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, exchange_account_id):
+        return str(exchange_account_id) in self._entries
+
+    # --- دریافت ---
+    def get(self, exchange_account):
+        """
+        Connected connector of an account (ExchangeAccount instance or id); None if it cannot connect.
+        """
+        is_instance = hasattr(exchange_account, 'pk')
+        key = str(exchange_account.pk if is_instance else exchange_account)
+        fingerprint = credentials_fingerprint(exchange_account) if is_instance else None
+        connector = self._hit(key, fingerprint)
+        if connector is not None:
+            return connector
+
+        with self._lock:
+            creating = self._creating.setdefault(key, threading.Lock())
+        with creating:
+            # ممکن است نخ دیگری همین حالا آن را ساخته باشد
+            connector = self._hit(key, fingerprint, count=False)
+            if connector is not None:
+                return connector
+            self.stats['misses'] += 1
+            metrics.incr(f'{METRIC_PREFIX}.misses')
+            account = exchange_account if is_instance else self._account_loader(exchange_account)
+            connector = self._factory(account)
+            if connector is not None:
+                self._add(key, PooledConnector(connector, credentials_fingerprint(account), self._clock()))
+        with self._lock:
+            if self._creating.get(key) is creating and not creating.locked():
+                self._creating.pop(key, None)
+        return connector
+
+    def _hit(self, key: str, fingerprint: Optional[tuple], count: bool = True):
+        stale = None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if fingerprint is not None and entry.fingerprint != fingerprint:
+                stale = self._entries.pop(key)
+                self.stats['refreshes'] += 1
+            else:
+                self._entries.move_to_end(key)
+                entry.last_used_at = self._clock()
+                if count:
+                    self.stats['hits'] += 1
+                return entry.connector
+        self._close(stale.connector)
+        return None
+
+    def _add(self, key: str, entry: PooledConnector):
+        evicted: List[PooledConnector] = []
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                evicted.append(previous)
+            self._entries[key] = entry
+            while len(self._entries) > self.options['max_connections']:
+                _, lru = self._entries.popitem(last=False)
+                evicted.append(lru)
+                self.stats['evictions'] += 1
+                metrics.incr(f'{METRIC_PREFIX}.evictions')
+            metrics.gauge(f'{METRIC_PREFIX}.size', len(self._entries))
+        for old in evicted:
+            self._close(old.connector)
+        if self._start_maintenance:
+            self._ensure_maintenance()
+
+    # --- باطل‌سازی ---
+    def invalidate(self, exchange_account_id) -> bool:
+        """
+        Drops (and disconnects) the pooled connector of an account; the next get() reconnects with fresh keys.
+        """
+        with self._lock:
+            entry = self._entries.pop(str(exchange_account_id), None)
+        if entry is None:
+            return False
+        self.stats['refreshes'] += 1
+        self._close(entry.connector)
+        return True
+
+    def clear(self):
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for entry in entries:
+            self._close(entry.connector)
+
+    @staticmethod
+    def _close(connector):
+        try:
+            connector.disconnect()
+        except Exception as e:
+            logger.warning(f"Error disconnecting pooled connector: {e}")
+
+    # --- نگهداری ---
+    def refresh_credentials(self, fingerprints: Optional[Dict[str, tuple]] = None) -> int:
+        """
+        Drops connectors whose account keys changed in another process (one query for all pooled accounts).
+        """
+        with self._lock:
+            pooled = {key: entry.fingerprint for key, entry in self._entries.items()}
+        if not pooled:
+            return 0
+        if fingerprints is None:
+            from apps.exchanges.models import ExchangeAccount # Import داخل تابع برای جلوگیری از حلقه
+            rows = ExchangeAccount.objects.filter(id__in=list(pooled), is_active=True).values_list(
+                'id', 'exchange_id', '_api_key_encrypted', '_api_secret_encrypted', 'encrypted_key_iv')
+            fingerprints = {str(row[0]): tuple(row[1:]) for row in rows}
+        # حساب‌های حذف‌شده یا غیرفعال هم کنار گذاشته می‌شوند
+        changed = [key for key, fingerprint in pooled.items() if fingerprints.get(key) != fingerprint]
+        return sum(1 for key in changed if self.invalidate(key))
+
+    def check_idle(self) -> Dict[str, int]:
+        """
+        Closes connectors unused for max_idle_seconds and health-checks those idle for idle_check_seconds.
+        """
+        now = self._clock()
+        options = self.options
+        expired, to_check = [], []
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                idle = now - entry.last_used_at
+                if idle >= options['max_idle_seconds']:
+                    expired.append(self._entries.pop(key))
+                elif idle >= options['idle_check_seconds'] and now - entry.last_checked_at >= options['idle_check_seconds']:
+                    to_check.append((key, entry))
+        for entry in expired:
+            self._close(entry.connector)
+
+        unhealthy = 0
+        for key, entry in to_check:
+            entry.last_checked_at = now
+            try:
+                # health_check نتیجه را در ConnectorHealthCheck ثبت می‌کند
+                healthy = entry.connector.health_check()
+            except Exception as e:
+                logger.warning(f"Health check of pooled connector for account {key} raised: {e}")
+                healthy = False
+            if not healthy:
+                unhealthy += 1
+                with self._lock:
+                    if self._entries.get(key) is entry:
+                        self._entries.pop(key)
+                self._close(entry.connector)
+        self.stats['unhealthy'] += unhealthy
+        metrics.gauge(f'{METRIC_PREFIX}.size', len(self._entries))
+        return {'expired': len(expired), 'checked': len(to_check), 'unhealthy': unhealthy}
+
+    def _ensure_maintenance(self):
+        if self._maintenance_thread is not None and self._maintenance_thread.is_alive():
+            return
+        with self._lock:
+            if self._maintenance_thread is not None and self._maintenance_thread.is_alive():
+                return
+            self._maintenance_thread = threading.Thread(target=self._maintenance_loop, name='connector-pool', daemon=True)
+            self._maintenance_thread.start()
+
+    def _maintenance_loop(self):
+        from django.db import close_old_connections # Import داخل تابع؛ فقط در نخ نگهداری
+
+        while self._entries:
+            time.sleep(self.options['maintenance_interval_seconds'])
+            close_old_connections()
+            try:
+                self.refresh_credentials()
+                self.check_idle()
+            except Exception as e:
+                logger.error(f"Connector pool maintenance failed: {e}")
+            finally:
+                close_old_connections()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return dict(self.stats, size=len(self._entries), max_connections=self.options['max_connections'])
+
+
+# استخر سراسری در سطح پروسس
+connector_pool = ConnectorPool()
@@ -0,0 +1,377 @@
+# apps/connectors/rate_limiter.py
+
+"""
+Weighted token-bucket rate limiter for outbound exchange requests.
+
+Every request takes tokens from two buckets at once (all-or-nothing):
+  - the exchange IP-weight bucket, charged with the endpoint weight
+    (ExchangeConnectorConfig.rate_limit_per_minute, refilled continuously),
+  - the (exchange account, endpoint) bucket, charged one token per request
+    (Exchange.rate_limit_per_second).
+The in-process backend is the fast path; the Redis backend runs the same check as
+one Lua script so several workers share the buckets atomically. When a request is
+throttled the limiter returns the exact time until enough tokens have refilled, so
+callers sleep once instead of polling. RateLimitState is only a periodic snapshot.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+from apps.core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+METRIC_PREFIX = 'connectors.rate_limit'
+KEY_PREFIX = 'connectors:rate_limit'
+DEFAULT_ENDPOINT_WEIGHT = 1
+
+
+class RateLimitConfigurationError(ValueError):
+    """
+    Raised when a request can never fit in a bucket (cost larger than its capacity).
+    """
+
+
+class BucketSpec:
+    """
+    One bucket touched by a request: capacity, refill rate (tokens/second) and the cost charged.
+    """
+    __slots__ = ('key', 'capacity', 'refill_per_second', 'cost')
+
+    def __init__(self, key: str, capacity: float, refill_per_second: float, cost: float = 1):
+        if capacity <= 0 or refill_per_second <= 0:
+            raise RateLimitConfigurationError(f"Bucket {key} needs a positive capacity and refill rate.")
+        if cost > capacity:
+            raise RateLimitConfigurationError(f"Cost {cost} exceeds capacity {capacity} of bucket {key}.")
+        self.key = key
+        self.capacity = float(capacity)
+        self.refill_per_second = float(refill_per_second)
+        self.cost = float(cost)
+
+    def __repr__(self):
+        return f"BucketSpec({self.key!r}, capacity={self.capacity}, refill={self.refill_per_second}/s, cost={self.cost})"
+
+
+def ip_bucket_key(exchange_id) -> str:
+    return f"{KEY_PREFIX}:ip:{exchange_id}"
+
+
+def account_bucket_key(exchange_account_id, endpoint_path: str) -> str:
+    return f"{KEY_PREFIX}:account:{exchange_account_id}:{endpoint_path}"
+
+
+def parse_account_bucket_key(key: str) -> Optional[Tuple[str, str]]:
+    prefix = f"{KEY_PREFIX}:account:"
+    if not key.startswith(prefix):
+        return None
+    account_id, _, endpoint_path = key[len(prefix):].partition(':')
+    return account_id, endpoint_path
+
+
+# --- بک‌اندهای نگهداری باکت‌ها ---
+
+class InMemoryRateLimiterBackend:
+    """
+    Buckets in process memory; one lock makes the multi-bucket check atomic.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._buckets: Dict[str, List[float]] = {} # key -> [tokens, updated_at, capacity, refill_per_second]
+        self._lock = threading.Lock()
+
+    def try_acquire(self, specs: List[BucketSpec]) -> float:
+        """
+        Takes all costs and returns 0.0, or takes nothing and returns the seconds to wait.
+        """
+        with self._lock:
+            now = self._clock()
+            levels = []
+            wait = 0.0
+            for spec in specs:
+                state = self._buckets.get(spec.key)
+                if state is None:
+                    tokens = spec.capacity
+                else:
+                    tokens = min(spec.capacity, state[0] + max(0.0, now - state[1]) * spec.refill_per_second)
+                levels.append(tokens)
+                if tokens < spec.cost:
+                    wait = max(wait, (spec.cost - tokens) / spec.refill_per_second)
+            if wait > 0:
+                return wait
+            for spec, tokens in zip(specs, levels):
+                self._buckets[spec.key] = [tokens - spec.cost, now, spec.capacity, spec.refill_per_second]
+            return 0.0
+
+    def snapshot(self) -> Dict[str, Tuple[float, float]]:
+        """
+        Current (tokens, capacity) of every known bucket.
+        """
+        with self._lock:
+            now = self._clock()
+            return {
+                key: (min(capacity, tokens + max(0.0, now - updated_at) * rate), capacity)
+                for key, (tokens, updated_at, capacity, rate) in self._buckets.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+# KEYS: کلید باکت‌ها؛ ARGV: سه‌تایی (capacity, refill در هر میلی‌ثانیه, cost) برای هر کلید
+# خروجی: '0' اگر همه توکن‌ها برداشته شد، وگرنه زمان انتظار (میلی‌ثانیه) به صورت رشته
+TOKEN_BUCKET_LUA = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) * 1000 + tonumber(now_parts[2]) / 1000
+local levels = {}
+local wait = 0
+for i = 1, #KEYS do
+    local capacity = tonumber(ARGV[(i - 1) * 3 + 1])
+    local rate = tonumber(ARGV[(i - 1) * 3 + 2])
+    local cost = tonumber(ARGV[(i - 1) * 3 + 3])
+    local state = redis.call('HMGET', KEYS[i], 'tokens', 'ts')
+    local tokens = tonumber(state[1])
+    local updated_at = tonumber(state[2])
+    if tokens == nil or updated_at == nil then
+        tokens = capacity
+        updated_at = now
+    end
+    tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * rate)
+    levels[i] = tokens
+    if tokens < cost then
+        wait = math.max(wait, (cost - tokens) / rate)
+    end
+end
+if wait > 0 then
+    return tostring(wait)
+end
+for i = 1, #KEYS do
+    local capacity = tonumber(ARGV[(i - 1) * 3 + 1])
+    local rate = tonumber(ARGV[(i - 1) * 3 + 2])
+    local cost = tonumber(ARGV[(i - 1) * 3 + 3])
+    redis.call('HSET', KEYS[i], 'tokens', tostring(levels[i] - cost), 'ts', tostring(now),
+               'capacity', tostring(capacity), 'rate', tostring(rate))
+    redis.call('PEXPIRE', KEYS[i], math.ceil(capacity / rate) + 1000)
+end
+return '0'
+"""
+
+
+class RedisRateLimiterBackend:
+    """
+    Buckets in Redis hashes shared by all workers; the check-and-take runs as one Lua script
+    using the Redis clock, so workers with skewed clocks still agree.
+    """
+
+    def __init__(self, client=None):
+        self._client = client
+        self._script = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import redis # Import داخل تابع؛ redis فقط برای این بک‌اند لازم است
+            self._client = redis.Redis(
+                host=getattr(settings, 'REDIS_HOST', 'localhost'),
+                port=getattr(settings, 'REDIS_PORT', 6379),
+                db=getattr(settings, 'REDIS_DB', 0),
+            )
+        return self._client
+
+    @property
+    def script(self):
+        if self._script is None:
+            self._script = self.client.register_script(TOKEN_BUCKET_LUA)
+        return self._script
+
+    def try_acquire(self, specs: List[BucketSpec]) -> float:
+        args = []
+        for spec in specs:
+            args.extend((repr(spec.capacity), repr(spec.refill_per_second / 1000.0), repr(spec.cost)))
+        result = self.script(keys=[spec.key for spec in specs], args=args)
+        if isinstance(result, bytes):
+            result = result.decode()
+        return float(result) / 1000.0
+
+    def snapshot(self) -> Dict[str, Tuple[float, float]]:
+        keys = list(self.client.scan_iter(match=f"{KEY_PREFIX}:*", count=500))
+        if not keys:
+            return {}
+        seconds, micros = self.client.time()
+        now = seconds * 1000 + micros / 1000
+        pipe = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipe.hmget(key, 'tokens', 'ts', 'capacity', 'rate')
+        buckets = {}
+        for key, values in zip(keys, pipe.execute()):
+            if any(value is None for value in values):
+                continue # کلید در فاصله scan و خواندن منقضی شده است
+            tokens, updated_at, capacity, rate = (float(value) for value in values)
+            name = key.decode() if isinstance(key, bytes) else key
+            buckets[name] = (min(capacity, tokens + max(0.0, now - updated_at) * rate), capacity)
+        return buckets
+
+    def reset(self):
+        keys = list(self.client.scan_iter(match=f"{KEY_PREFIX}:*", count=500))
+        if keys:
+            self.client.delete(*keys)
+
+
+def get_rate_limiter_backend():
+    backend = getattr(settings, 'CONNECTOR_RATE_LIMIT_BACKEND', 'memory')
+    if backend == 'redis':
+        return RedisRateLimiterBackend()
+    return InMemoryRateLimiterBackend()
+
+
+# --- محدودکننده ---
+
+class RateLimiter:
+    """
+    Builds the buckets of a request, takes its tokens and waits exactly until refill when throttled.
+    Endpoint weights are read once per exchange from ExchangeAPIEndpoint and cached.
+    """
+
+    def __init__(self, backend=None, weights_ttl_seconds: Optional[float] = None, clock=time.monotonic):
+        self._backend = backend
+        self._weights_ttl_seconds = weights_ttl_seconds
+        self._clock = clock
+        self._weights: Dict[str, Tuple[float, Dict[Tuple[str, Optional[str]], int]]] = {}
+        self._weights_lock = threading.Lock()
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = get_rate_limiter_backend()
+        return self._backend
+
+    @property
+    def weights_ttl_seconds(self) -> float:
+        if self._weights_ttl_seconds is not None:
+            return self._weights_ttl_seconds
+        return float(getattr(settings, 'CONNECTOR_ENDPOINT_WEIGHTS_TTL_SECONDS', 300))
+
+    # --- وزن endpointها ---
+    @staticmethod
+    def _load_endpoint_weights(exchange_id) -> Dict[Tuple[str, Optional[str]], int]:
+        from .models import ExchangeAPIEndpoint # Import داخل تابع برای جلوگیری از حلقه
+
+        weights = {}
+        rows = ExchangeAPIEndpoint.objects.filter(exchange_id=exchange_id).values_list('endpoint_path', 'method', 'rate_limit_weight')
+        for endpoint_path, method, weight in rows:
+            weights[(endpoint_path, method)] = weight
+            # بدون method، بیشترین وزن همان مسیر در نظر گرفته می‌شود
+            weights[(endpoint_path, None)] = max(weight, weights.get((endpoint_path, None), 0))
+        return weights
+
+    def get_endpoint_weight(self, exchange_id, endpoint_path: str, method: Optional[str] = None) -> int:
+        cache_key = str(exchange_id)
+        now = self._clock()
+        cached = self._weights.get(cache_key)
+        if cached is None or now - cached[0] > self.weights_ttl_seconds:
+            with self._weights_lock:
+                cached = self._weights.get(cache_key)
+                if cached is None or now - cached[0] > self.weights_ttl_seconds:
+                    cached = (now, self._load_endpoint_weights(exchange_id))
+                    self._weights[cache_key] = cached
+        weights = cached[1]
+        if method is not None and (endpoint_path, method.upper()) in weights:
+            return weights[(endpoint_path, method.upper())]
+        return weights.get((endpoint_path, None), DEFAULT_ENDPOINT_WEIGHT)
+
+    def invalidate_endpoint_weights(self, exchange_id=None):
+        with self._weights_lock:
+            if exchange_id is None:
+                self._weights.clear()
+            else:
+                self._weights.pop(str(exchange_id), None)
+
+    # --- باکت‌ها ---
+    @staticmethod
+    def bucket_specs(exchange_id, exchange_account_id, endpoint_path: str, weight: int,
+                     ip_weight_per_minute: int, account_requests_per_second: int) -> List[BucketSpec]:
+        return [
+            BucketSpec(ip_bucket_key(exchange_id), ip_weight_per_minute, ip_weight_per_minute / 60.0, weight),
+            BucketSpec(account_bucket_key(exchange_account_id, endpoint_path), account_requests_per_second, account_requests_per_second, 1),
+        ]
+
+    def try_acquire(self, specs: List[BucketSpec]) -> float:
+        """
+        Returns 0.0 when the request may go out now, otherwise the exact seconds until it can.
+        """
+        wait = self.backend.try_acquire(specs)
+        if wait > 0:
+            metrics.incr(f'{METRIC_PREFIX}.throttled')
+        else:
+            metrics.incr(f'{METRIC_PREFIX}.acquired')
+        return wait
+
+    def acquire(self, specs: List[BucketSpec], timeout: Optional[float] = None) -> bool:
+        """
+        Blocks until the tokens are taken; False if that would take longer than timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        waited = 0.0
+        while True:
+            wait = self.try_acquire(specs)
+            if wait <= 0:
+                if waited:
+                    metrics.observe(f'{METRIC_PREFIX}.wait_seconds', waited)
+                return True
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            # سایر درخواست‌ها ممکن است توکن‌های بازیابی‌شده را زودتر بردارند؛ پس دوباره تلاش می‌شود
+            time.sleep(wait)
+            waited += wait
+
+    async def acquire_async(self, specs: List[BucketSpec], timeout: Optional[float] = None) -> bool:
+        """
+        Same as acquire() but yields to the event loop while waiting.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        waited = 0.0
+        while True:
+            wait = self.try_acquire(specs)
+            if wait <= 0:
+                if waited:
+                    metrics.observe(f'{METRIC_PREFIX}.wait_seconds', waited)
+                return True
+            if deadline is not None and loop.time() + wait > deadline:
+                return False
+            await asyncio.sleep(wait)
+            waited += wait
+
+    # --- snapshot برای مشاهده‌پذیری ---
+    def snapshot(self) -> List[Dict]:
+        """
+        Per (exchange account, endpoint) bucket levels; IP buckets are reported as gauges only.
+        """
+        rows = []
+        for key, (tokens, capacity) in self.backend.snapshot().items():
+            parsed = parse_account_bucket_key(key)
+            if parsed is None:
+                metrics.gauge(f'{METRIC_PREFIX}.ip_tokens.{key.rsplit(":", 1)[-1]}', tokens)
+                continue
+            account_id, endpoint_path = parsed
+            rows.append({
+                'exchange_account_id': account_id,
+                'endpoint_path': endpoint_path,
+                'tokens': tokens,
+                'capacity': capacity,
+            })
+        return rows
+
+    def reset(self):
+        self.backend.reset()
+        self.invalidate_endpoint_weights()
+
+
+# محدودکننده سراسری در سطح پروسس (بک‌اند از settings.CONNECTOR_RATE_LIMIT_BACKEND)
+rate_limiter = RateLimiter()
@@ -0,0 +1,56 @@
+# apps/connectors/signals.py
+
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from apps.exchanges.models import ExchangeAccount
+from .models import APICredential
+from .pool import connector_pool
+
+
+@receiver(post_save, sender=APICredential)
+@receiver(post_delete, sender=APICredential)
+def refresh_pooled_connector_on_credential_change(sender, instance, **kwargs):
+    """
+    New or rotated API keys: the pooled connector is dropped and rebuilt on next use.
+    """
+    connector_pool.invalidate(instance.exchange_account_id)
+
+
+# فیلدهایی که کانکتور pool شده به آن‌ها وابسته است (صرافی و کلیدها)
+POOLED_CONNECTOR_FIELDS = ('exchange_id', '_api_key_encrypted', '_api_secret_encrypted', 'encrypted_key_iv', 'extra_credentials')
+
+
+def _touches_pooled_connector(update_fields) -> bool:
+    if update_fields is None:
+        return True
+    watched = set(POOLED_CONNECTOR_FIELDS) | {'exchange', 'is_active'}
+    return bool(watched.intersection(update_fields))
+
+
+@receiver(pre_save, sender=ExchangeAccount)
+def capture_pooled_connector_fields(sender, instance, update_fields=None, **kwargs):
+    """ذخیره مقادیر قبلی فیلدهای وابسته به کانکتور (فقط وقتی save این فیلدها را تغییر دهد)"""
+    instance._pooled_connector_state = None
+    if instance._state.adding or instance.pk is None or not _touches_pooled_connector(update_fields):
+        return
+    instance._pooled_connector_state = (
+        ExchangeAccount.objects.filter(pk=instance.pk).values(*POOLED_CONNECTOR_FIELDS, 'is_active').first()
+    )
+
+
+@receiver(post_save, sender=ExchangeAccount)
+def refresh_pooled_connector_on_account_change(sender, instance, created, **kwargs):
+    # تغییر کلیدها با fingerprint در get() هم تشخیص داده می‌شود؛ اینجا برای غیرفعال‌سازی و تغییر صرافی/کلیدها
+    old = getattr(instance, '_pooled_connector_state', None)
+    instance._pooled_connector_state = None
+    if created or old is None:
+        return
+    deactivated = old['is_active'] and not instance.is_active
+    changed = any(old[field] != getattr(instance, field) for field in POOLED_CONNECTOR_FIELDS)
+    if deactivated or changed:
+        connector_pool.invalidate(instance.id)
+
+
+@receiver(pre_delete, sender=ExchangeAccount)
+def drop_pooled_connector_on_account_delete(sender, instance, **kwargs):
+    connector_pool.invalidate(instance.id)
@@ -1,7 +1,6 @@
 # apps/connectors/tasks.py
 from celery import shared_task
 from .models import ConnectorSession
-from .registry import get_connector
 from apps.exchanges.models import ExchangeAccount
 from django.utils import timezone
 
@@ -12,21 +11,15 @@ def perform_health_check(exchange_account_id: int):
     تسک پس‌زمینه برای بررسی سلامت یک حساب صرافی.
     """
     try:
-        exchange_account = ExchangeAccount.objects.get(id=exchange_account_id)
-        # دریافت کانکتور مربوطه
-        ConnectorClass = get_connector(exchange_account.exchange.code)
-        if not ConnectorClass:
-            raise ValueError(f"Connector not found for exchange: {exchange_account.exchange.code}")
-
-        # فرض کنید کلیدها از مدل APICredential گرفته می‌شود
-        creds = exchange_account.api_credential
-        connector = ConnectorClass(
-            api_key=creds.api_key_encrypted,
-            api_secret=creds.api_secret_encrypted,
-            exchange_account_id=exchange_account_id
-        )
-        connector.connect()
+        from .pool import connector_pool # Import داخل تابع برای جلوگیری از حلقه
+        exchange_account = ExchangeAccount.objects.select_related('exchange').get(id=exchange_account_id)
+        # کانکتور متصل از استخر (در صورت نبود، یک بار ساخته و نگه داشته می‌شود)
+        connector = connector_pool.get(exchange_account)
+        if connector is None:
+            raise ValueError(f"Could not connect to {exchange_account.exchange.code}")
         is_healthy = connector.health_check()
+        if not is_healthy:
+            connector_pool.invalidate(exchange_account_id)
         return f"Health check for {exchange_account} completed. Healthy: {is_healthy}"
     except Exception as e:
         return f"Health check failed for account {exchange_account_id}: {e}"
@@ -59,3 +52,37 @@ def attempt_reconnect(session_id: int):
         return f"Reconnection attempt for session {session_id} successful."
     except Exception as e:
         return f"Reconnection attempt for session {session_id} failed: {e}"
+
+
+@shared_task
+def snapshot_rate_limit_state():
+    """
+    تسک دوره‌ای برای ذخیره وضعیت باکت‌های محدودیت درخواست در RateLimitState (فقط برای مشاهده‌پذیری).
+    با بک‌اند memory فقط باکت‌های همان پروسس دیده می‌شوند؛ با بک‌اند redis وضعیت مشترک همه workerها.
+    """
+    from django.db import transaction
+    from .models import RateLimitState
+    from .rate_limiter import rate_limiter
+
+    now = timezone.now()
+    rows = rate_limiter.snapshot()
+    states = []
+    for row in rows:
+        tokens, capacity = row['tokens'], row['capacity']
+        is_rate_limited = tokens < 1
+        states.append(RateLimitState(
+            exchange_account_id=row['exchange_account_id'],
+            endpoint_path=row['endpoint_path'],
+            window_start_at=now,
+            requests_count=int(round(capacity - tokens)), # توکن‌های مصرف‌شده‌ای که هنوز بازیابی نشده‌اند
+            is_rate_limited=is_rate_limited,
+            # نرخ بازیابی باکت حساب برابر ظرفیت آن در هر ثانیه است
+            retry_after=now + timezone.timedelta(seconds=(1 - tokens) / capacity) if is_rate_limited else None,
+        ))
+    with transaction.atomic():
+        for row in rows:
+            RateLimitState.objects.filter(
+                exchange_account_id=row['exchange_account_id'], endpoint_path=row['endpoint_path'],
+            ).delete()
+        RateLimitState.objects.bulk_create(states)
+    return f"Snapshotted {len(states)} rate limit buckets."
@@ -0,0 +1,301 @@
+# apps/connectors/transport.py
+
+"""
+Shared HTTP transport for exchange REST calls.
+
+One aiohttp ClientSession per event loop holds a bounded per-host connection pool with DNS
+caching and keep-alive, so connectors and backfill workers reuse warm TLS connections instead
+of opening one per request (or per connector instance). Synchronous callers (Celery tasks,
+backfill threads, ExchangeConnector methods) go through a single background loop owned by
+the process, so they share the same pool.
+
+Every attempt takes its tokens from the rate limiter first. Idempotent methods are retried
+on timeouts, connection errors, 429 and 5xx with full-jitter backoff (honouring Retry-After);
+POST/other unsafe requests are retried only when an idempotency key is given, which is sent
+unchanged on every attempt so the exchange can de-duplicate (e.g. Binance newClientOrderId).
+A request that never reached the exchange (connect failure) is always safe to retry.
+"""
+
+import asyncio
+import logging
+import random
+import threading
+import time
+import weakref
+from typing import Any, Callable, Dict, List, Optional
+
+from django.conf import settings
+
+from apps.core.metrics import metrics
+from apps.exchanges.exceptions import ConnectorError, ExchangeConnectionError, ExchangeRateLimitExceededError
+from .rate_limiter import rate_limiter
+
+try:
+    import aiohttp
+except ImportError:
+    # aiohttp اختیاری است (فقط پروسس‌هایی که REST صرافی را صدا می‌زنند به آن نیاز دارند)
+    aiohttp = None
+
+logger = logging.getLogger(__name__)
+
+METRIC_PREFIX = 'connectors.http'
+
+HTTP_TRANSPORT_AVAILABLE = aiohttp is not None
+
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'})
+# 418 (بن IP بایننس) عمداً تکرار نمی‌شود
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+
+# تنظیمات پیش‌فرض؛ settings.CONNECTOR_HTTP آن‌ها را بازنویسی می‌کند
+DEFAULT_CONNECTOR_HTTP = {
+    'limit': 100,                   # کل اتصال‌های باز هر پروسس
+    'limit_per_host': 20,           # اتصال‌های همزمان به هر host صرافی
+    'dns_cache_seconds': 300,
+    'keepalive_seconds': 60,
+    'connect_timeout_seconds': 5.0,
+    'read_timeout_seconds': 10.0,
+    'total_timeout_seconds': 15.0,
+    'max_retries': 2,
+    'retry_backoff_seconds': 0.2,
+    'max_backoff_seconds': 5.0,
+    'rate_limit_timeout_seconds': 30.0,
+}
+
+# خطاهایی که قطعاً قبل از ارسال درخواست رخ داده‌اند
+_NOT_SENT_ERRORS = (ConnectionRefusedError,) + ((aiohttp.ClientConnectorError,) if aiohttp is not None else ())
+_TRANSIENT_ERRORS = (asyncio.TimeoutError, OSError) + ((aiohttp.ClientError,) if aiohttp is not None else ())
+
+
+def get_http_transport_settings() -> Dict[str, Any]:
+    merged = dict(DEFAULT_CONNECTOR_HTTP)
+    merged.update(getattr(settings, 'CONNECTOR_HTTP', {}) or {})
+    return merged
+
+
+class HttpResponse:
+    """
+    Fully read response (the connection is back in the pool once this exists).
+    """
+    __slots__ = ('method', 'url', 'status', 'headers', 'body', 'elapsed_ms', 'attempts')
+
+    def __init__(self, method: str, url: str, status: int, headers: Dict[str, str], body: bytes,
+                 elapsed_ms: float, attempts: int = 1):
+        self.method = method
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.elapsed_ms = elapsed_ms
+        self.attempts = attempts
+
+    def __repr__(self):
+        return f"HttpResponse({self.method} {self.url} -> {self.status}, {self.elapsed_ms:.1f} ms)"
+
+    @property
+    def ok(self) -> bool:
+        return 200 <= self.status < 300
+
+    def json(self):
+        from apps.market_data.normalizers import loads # Import داخل تابع برای جلوگیری از حلقه
+        return loads(self.body)
+
+    def text(self) -> str:
+        return self.body.decode('utf-8', errors='replace')
+
+    def raise_for_status(self) -> 'HttpResponse':
+        if self.status in (418, 429):
+            raise ExchangeRateLimitExceededError(f"{self.method} {self.url} rate limited ({self.status}): {self.text()[:200]}")
+        if not self.ok:
+            raise ConnectorError(f"{self.method} {self.url} failed ({self.status}): {self.text()[:200]}")
+        return self
+
+
+def _retry_after(headers: Dict[str, str]) -> Optional[float]:
+    value = headers.get('Retry-After') or headers.get('retry-after')
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except ValueError:
+        return None
+
+
+class HttpTransport:
+    """
+    Pooled async HTTP client bound to one event loop.
+    """
+
+    def __init__(self, options: Optional[Dict[str, Any]] = None, session_factory: Optional[Callable] = None,
+                 rate_limiter=None, sleep: Callable = asyncio.sleep, rng: Optional[random.Random] = None):
+        self.options = options or get_http_transport_settings()
+        self._session_factory = session_factory or self._create_session
+        self._rate_limiter = rate_limiter
+        self._sleep = sleep
+        self._rng = rng or random.Random()
+        self._session = None
+        self.stats = {'requests': 0, 'retries': 0, 'errors': 0}
+
+    def _create_session(self):
+        if aiohttp is None:
+            raise ConnectorError("aiohttp is required for the connector HTTP transport.")
+        options = self.options
+        connector = aiohttp.TCPConnector(
+            limit=options['limit'],
+            limit_per_host=options['limit_per_host'],
+            ttl_dns_cache=options['dns_cache_seconds'],
+            use_dns_cache=True,
+            keepalive_timeout=options['keepalive_seconds'],
+            enable_cleanup_closed=True,
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=options['total_timeout_seconds'],
+            connect=options['connect_timeout_seconds'],
+            sock_read=options['read_timeout_seconds'],
+        )
+        return aiohttp.ClientSession(connector=connector, timeout=timeout, raise_for_status=False)
+
+    @property
+    def session(self):
+        # جلسه باید داخل حلقه رویداد ساخته شود (نه در __init__ کانکتورها)
+        if self._session is None or getattr(self._session, 'closed', False):
+            self._session = self._session_factory()
+        return self._session
+
+    @property
+    def rate_limiter(self):
+        return self._rate_limiter or rate_limiter
+
+    async def close(self):
+        if self._session is not None and not getattr(self._session, 'closed', False):
+            await self._session.close()
+        self._session = None
+
+    async def request(self, method: str, url: str, *, params: Optional[Dict] = None, data: Any = None,
+                      json: Any = None, headers: Optional[Dict[str, str]] = None,
+                      rate_limit: Optional[List] = None, idempotency_key: Optional[str] = None,
+                      idempotency_param: Optional[str] = None, prepare: Optional[Callable[[Dict], Dict]] = None,
+                      timeout: Optional[float] = None, retries: Optional[int] = None) -> HttpResponse:
+        """
+        Sends one request with rate limiting and retries; 4xx/5xx responses are returned, not raised.
+
+        rate_limit: BucketSpecs charged before every attempt (ExchangeConnector._rate_limit_buckets).
+        idempotency_key: makes an unsafe request retryable; sent as idempotency_param in the
+            params/body, or as the Idempotency-Key header.
+        prepare: called with {'params', 'data', 'json', 'headers'} before each attempt and returns
+            the dict to send (fresh timestamp and signature per attempt).
+        """
+        method = method.upper()
+        options = self.options
+        max_retries = options['max_retries'] if retries is None else retries
+        retryable = method in IDEMPOTENT_METHODS or idempotency_key is not None
+        parts = {'params': dict(params) if params else None, 'data': data, 'json': json, 'headers': dict(headers or {})}
+        if idempotency_key is not None:
+            self._add_idempotency_key(parts, idempotency_key, idempotency_param)
+
+        started = time.perf_counter()
+        attempt = 0
+        while True:
+            if rate_limit and not await self.rate_limiter.acquire_async(rate_limit, timeout=options['rate_limit_timeout_seconds']):
+                raise ExchangeRateLimitExceededError(f"Rate limit wait for {method} {url} exceeded {options['rate_limit_timeout_seconds']}s.")
+            sent = prepare(dict(parts)) if prepare is not None else parts
+            self.stats['requests'] += 1
+            try:
+                response = await self._send(method, url, sent, timeout)
+            except _TRANSIENT_ERRORS as e:
+                not_sent = isinstance(e, _NOT_SENT_ERRORS)
+                if attempt >= max_retries or not (retryable or not_sent):
+                    self.stats['errors'] += 1
+                    metrics.incr(f'{METRIC_PREFIX}.errors')
+                    raise ExchangeConnectionError(f"{method} {url} failed after {attempt + 1} attempt(s): {e!r}")
+                delay = None
+            else:
+                if response.status not in RETRY_STATUSES or not retryable or attempt >= max_retries:
+                    response.elapsed_ms = (time.perf_counter() - started) * 1000
+                    response.attempts = attempt + 1
+                    metrics.observe(f'{METRIC_PREFIX}.request_ms', response.elapsed_ms)
+                    return response
+                delay = _retry_after(response.headers)
+            self.stats['retries'] += 1
+            metrics.incr(f'{METRIC_PREFIX}.retries')
+            if delay is None:
+                delay = self._rng.uniform(0, min(options['max_backoff_seconds'], options['retry_backoff_seconds'] * 2 ** attempt))
+            await self._sleep(delay)
+            attempt += 1
+
+    @staticmethod
+    def _add_idempotency_key(parts: Dict, key: str, param: Optional[str]):
+        if param is None:
+            parts['headers'][IDEMPOTENCY_HEADER] = key
+        elif isinstance(parts['json'], dict):
+            parts['json'] = dict(parts['json'], **{param: key})
+        elif isinstance(parts['data'], dict):
+            parts['data'] = dict(parts['data'], **{param: key})
+        else:
+            parts['params'] = dict(parts['params'] or {}, **{param: key})
+
+    async def _send(self, method: str, url: str, parts: Dict, timeout: Optional[float]) -> HttpResponse:
+        kwargs = {key: value for key, value in parts.items() if value is not None and value != {}}
+        if timeout is not None and aiohttp is not None:
+            kwargs['timeout'] = aiohttp.ClientTimeout(total=timeout)
+        async with self.session.request(method, url, **kwargs) as response:
+            body = await response.read()
+            return HttpResponse(method, url, response.status, dict(response.headers), body, 0.0)
+
+
+# --- یک transport برای هر حلقه رویداد ---
+
+_transports: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, HttpTransport]' = weakref.WeakKeyDictionary()
+
+
+def get_http_transport() -> HttpTransport:
+    """
+    Transport of the running event loop (aiohttp sessions cannot be shared across loops).
+    """
+    loop = asyncio.get_running_loop()
+    transport = _transports.get(loop)
+    if transport is None:
+        transport = _transports[loop] = HttpTransport()
+    return transport
+
+
+async def close_http_transport():
+    transport = _transports.pop(asyncio.get_running_loop(), None)
+    if transport is not None:
+        await transport.close()
+
+
+class _BackgroundLoop:
+    """
+    Daemon event loop that owns the pool used by synchronous callers.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None or self._loop.is_closed():
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name='connector-http', daemon=True)
+                thread.start()
+                self._loop = loop
+            return self._loop
+
+    def run(self, coroutine_factory: Callable, timeout: Optional[float] = None):
+        future = asyncio.run_coroutine_threadsafe(coroutine_factory(), self.loop())
+        return future.result(timeout)
+
+
+_background = _BackgroundLoop()
+
+
+def http_request_sync(method: str, url: str, **kwargs) -> HttpResponse:
+    """
+    Blocking HttpTransport.request() on the process-wide pooled session.
+    """
+    options = get_http_transport_settings()
+    retries = options['max_retries'] if kwargs.get('retries') is None else kwargs['retries']
+    # سقف انتظار: همه تلاش‌ها، backoffها و انتظار محدودکننده
+    per_attempt = kwargs.get('timeout') or options['total_timeout_seconds']
+    deadline = (retries + 1) * (per_attempt + options['max_backoff_seconds']) + options['rate_limit_timeout_seconds']
+    return _background.run(lambda: get_http_transport().request(method, url, **kwargs), timeout=deadline)
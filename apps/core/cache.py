@@ -8,6 +8,10 @@ from decimal import Decimal
 import json
 import hashlib
 import secrets
+import threading
+import time
+from django.conf import settings
+from .metrics import metrics
 from .models import CacheEntry # فرض بر این است که مدل CacheEntry در core یا instruments قرار دارد
 
 logger = logging.getLogger(__name__)
@@ -206,6 +210,303 @@ def invalidate_cache_for_strategy(strategy_id: str):
     CacheService.bulk_invalidate_cached_values(related_keys)
     logger.info(f"All cache entries related to strategy '{strategy_id}' invalidated.")
 
+# --- کش نتایج اندیکاتور (آدرس‌دهی بر اساس محتوا) ---
+
+def canonicalize_indicator_params(params: Optional[dict]) -> dict:
+    """
+    Normalizes indicator parameters so equivalent configs map to the same key
+    (sorted keys, lower-case names, 20.0 -> 20, Decimal -> float, numeric strings -> numbers).
+    """
+    canonical = {}
+    for name, value in (params or {}).items():
+        if isinstance(value, Decimal):
+            value = float(value)
+        elif isinstance(value, str):
+            stripped = value.strip()
+            try:
+                value = float(stripped)
+            except ValueError:
+                value = stripped
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        canonical[str(name).strip().lower()] = value
+    return dict(sorted(canonical.items()))
+
+
+class IndicatorResultCache:
+    """
+    Content-addressed cache for indicator results keyed by
+    (instrument, timeframe, indicator code, canonical params, last bar timestamp).
+    Two tiers: a size-bounded in-process LRU and an optional Redis tier shared by all workers.
+    Entries are indexed per series so new or corrected bars invalidate only dependent entries.
+    Invalidation reaches only this process's LRU (and Redis), so the local tier never holds
+    results for a still-open bar and keeps other entries for at most a short TTL.
+    """
+    KEY_PREFIX = 'indicator_result'
+
+    def __init__(self, max_entries: Optional[int] = None, max_bytes: Optional[int] = None, redis_client=None,
+                 use_redis: Optional[bool] = None, local_ttl_seconds: Optional[float] = None):
+        from collections import OrderedDict
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._local_ttl = local_ttl_seconds
+        self._entries = OrderedDict() # key -> (serialized, series, last_bar_ts, stored_at)
+        self._series_index: dict = {} # (instrument_id, timeframe) -> {key: last_bar_ts}
+        self._series_latest: dict = {}
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self._key_locks: dict = {}
+        self._redis = redis_client
+        self._use_redis = use_redis
+
+    # --- تنظیمات ---
+    @property
+    def max_entries(self) -> int:
+        return self._max_entries or getattr(settings, 'INDICATOR_CACHE_MAX_ENTRIES', 10000)
+
+    @property
+    def max_bytes(self) -> int:
+        return self._max_bytes or getattr(settings, 'INDICATOR_CACHE_MAX_BYTES', 64 * 1024 * 1024)
+
+    @property
+    def local_ttl(self) -> float:
+        if self._local_ttl is not None:
+            return self._local_ttl
+        return float(getattr(settings, 'INDICATOR_CACHE_LOCAL_TTL_SECONDS', 30))
+
+    @property
+    def redis(self):
+        use_redis = self._use_redis if self._use_redis is not None else getattr(settings, 'INDICATOR_CACHE_REDIS_ENABLED', False)
+        if not use_redis:
+            return None
+        if self._redis is None:
+            import redis # Import داخل تابع؛ redis فقط برای لایه دوم لازم است
+            self._redis = redis.Redis(
+                host=getattr(settings, 'REDIS_HOST', 'localhost'),
+                port=getattr(settings, 'REDIS_PORT', 6379),
+                db=getattr(settings, 'REDIS_DB', 0),
+            )
+        return self._redis
+
+    @property
+    def redis_ttl(self) -> int:
+        return getattr(settings, 'INDICATOR_CACHE_REDIS_TTL_SECONDS', 24 * 3600)
+
+    # --- کلیدها ---
+    @classmethod
+    def make_key(cls, instrument_id, timeframe: str, code: str, params: Optional[dict], last_bar_ts: int) -> str:
+        payload = json.dumps(
+            [str(instrument_id), timeframe, code.upper(), canonicalize_indicator_params(params), int(last_bar_ts)],
+            sort_keys=True, separators=(',', ':'), default=str,
+        )
+        return f"{cls.KEY_PREFIX}_{hashlib.sha256(payload.encode()).hexdigest()}"
+
+    @classmethod
+    def _series_index_key(cls, instrument_id, timeframe: str) -> str:
+        return f"{cls.KEY_PREFIX}_deps_{instrument_id}_{timeframe}"
+
+    # --- خواندن/نوشتن ---
+    def get(self, instrument_id, timeframe: str, code: str, params: Optional[dict], last_bar_ts: int) -> Optional[Any]:
+        key = self.make_key(instrument_id, timeframe, code, params, last_bar_ts)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[3] > self.local_ttl:
+                # ممکن است در پروسس دیگری باطل شده باشد؛ از لایه مشترک یا محاسبه مجدد خوانده می‌شود
+                self._drop_local(key)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                metrics.incr('indicator_cache.hits.local')
+                return json.loads(entry[0])
+
+        if self.redis is not None:
+            try:
+                raw = self.redis.get(key)
+            except Exception as e:
+                logger.error(f"Error reading indicator result '{key}' from Redis: {str(e)}")
+                raw = None
+            if raw is not None:
+                serialized = raw.decode() if isinstance(raw, bytes) else raw
+                self._store_local(key, serialized, (instrument_id, timeframe), int(last_bar_ts))
+                metrics.incr('indicator_cache.hits.redis')
+                return json.loads(serialized)
+
+        metrics.incr('indicator_cache.misses')
+        return None
+
+    def set(self, instrument_id, timeframe: str, code: str, params: Optional[dict], last_bar_ts: int, value: Any):
+        key = self.make_key(instrument_id, timeframe, code, params, last_bar_ts)
+        serialized = json.dumps(value, default=str)
+        self._store_local(key, serialized, (instrument_id, timeframe), int(last_bar_ts))
+        if self.redis is not None:
+            try:
+                pipe = self.redis.pipeline(transaction=False)
+                pipe.set(key, serialized, ex=self.redis_ttl)
+                pipe.zadd(self._series_index_key(instrument_id, timeframe), {key: int(last_bar_ts)})
+                pipe.expire(self._series_index_key(instrument_id, timeframe), self.redis_ttl)
+                pipe.execute()
+            except Exception as e:
+                logger.error(f"Error writing indicator result '{key}' to Redis: {str(e)}")
+
+    def get_or_compute(self, instrument_id, timeframe: str, code: str, params: Optional[dict], last_bar_ts: int, compute_func):
+        """
+        Returns the cached result or computes it once (concurrent callers for the same key wait
+        for the first computation instead of repeating it).
+        """
+        value = self.get(instrument_id, timeframe, code, params, last_bar_ts)
+        if value is not None:
+            return value
+        key = self.make_key(instrument_id, timeframe, code, params, last_bar_ts)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+            if entry is not None:
+                metrics.incr('indicator_cache.hits.local')
+                return json.loads(entry[0])
+            value = compute_func()
+            metrics.incr('indicator_cache.computes')
+            if value is not None:
+                self.set(instrument_id, timeframe, code, params, last_bar_ts, value)
+        with self._lock:
+            self._key_locks.pop(key, None)
+        return value
+
+    @staticmethod
+    def _bar_is_open(timeframe: str, last_bar_ts: int) -> bool:
+        from apps.market_data.resampling import timeframe_to_ms # Import داخل تابع برای جلوگیری از حلقه
+        try:
+            timeframe_ms = timeframe_to_ms(timeframe)
+        except ValueError:
+            return True # تایم‌فریم ناشناخته: محتاطانه باز فرض می‌شود
+        return int(last_bar_ts) + timeframe_ms > time.time() * 1000
+
+    def _drop_local(self, key: str):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= len(entry[0])
+                self._series_index.get(entry[1], {}).pop(key, None)
+
+    def _store_local(self, key: str, serialized: str, series: tuple, last_bar_ts: int):
+        # نتیجه کندل باز با هر تیک تغییر می‌کند و ابطالش به LRU پروسس‌های دیگر نمی‌رسد؛ فقط در Redis نگه داشته می‌شود
+        if self._bar_is_open(series[1], last_bar_ts):
+            return
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= len(self._entries[key][0])
+            self._entries[key] = (serialized, series, last_bar_ts, time.monotonic())
+            self._entries.move_to_end(key)
+            self._bytes += len(serialized)
+            self._series_index.setdefault(series, {})[key] = last_bar_ts
+            # حذف LRU تا زمانی که محدودیت تعداد و حجم رعایت شود
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                evicted_key, (evicted_value, evicted_series, _, _) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted_value)
+                self._series_index.get(evicted_series, {}).pop(evicted_key, None)
+                metrics.incr('indicator_cache.evictions')
+
+    # --- ابطال وابسته به سری ---
+    def on_bar(self, instrument_id, timeframe: str, bar_ts: int) -> int:
+        """
+        Called when a bar for a series is stored. A new bar supersedes results computed for
+        older bars; a corrected (older or equal) bar invalidates results that include it.
+        Other series are untouched. Returns the number of invalidated entries.
+        """
+        series = (instrument_id, timeframe)
+        bar_ts = int(bar_ts)
+        with self._lock:
+            latest = self._series_latest.get(series)
+            self._series_latest[series] = bar_ts if latest is None else max(latest, bar_ts)
+        if latest is None or bar_ts > latest:
+            return self.invalidate_series(instrument_id, timeframe, before_ts=bar_ts)
+        return self.invalidate_series(instrument_id, timeframe, from_ts=bar_ts)
+
+    def invalidate_series(self, instrument_id, timeframe: str, from_ts: Optional[int] = None, before_ts: Optional[int] = None) -> int:
+        """
+        Removes entries of one series whose last bar is >= from_ts and/or < before_ts
+        (all entries of the series if neither is given).
+        """
+        def affected(ts: int) -> bool:
+            if from_ts is not None and ts >= from_ts:
+                return True
+            if before_ts is not None and ts < before_ts:
+                return True
+            return from_ts is None and before_ts is None
+
+        series = (instrument_id, timeframe)
+        with self._lock:
+            index = self._series_index.get(series, {})
+            keys = [key for key, ts in index.items() if affected(ts)]
+            for key in keys:
+                index.pop(key, None)
+                entry = self._entries.pop(key, None)
+                if entry is not None:
+                    self._bytes -= len(entry[0])
+
+        removed = len(keys)
+        if self.redis is not None:
+            try:
+                removed = max(removed, self._invalidate_redis(instrument_id, timeframe, from_ts, before_ts))
+            except Exception as e:
+                logger.error(f"Error invalidating indicator results in Redis for {instrument_id}/{timeframe}: {str(e)}")
+        if removed:
+            metrics.incr('indicator_cache.invalidations', removed)
+            logger.debug(f"Invalidated {removed} indicator results for series {instrument_id}/{timeframe}.")
+        return removed
+
+    def _invalidate_redis(self, instrument_id, timeframe: str, from_ts: Optional[int], before_ts: Optional[int]) -> int:
+        index_key = self._series_index_key(instrument_id, timeframe)
+        ranges = []
+        if from_ts is None and before_ts is None:
+            ranges.append(('-inf', '+inf'))
+        if from_ts is not None:
+            ranges.append((from_ts, '+inf'))
+        if before_ts is not None:
+            ranges.append(('-inf', f'({before_ts}'))
+        keys = set()
+        for low, high in ranges:
+            keys.update(self.redis.zrangebyscore(index_key, low, high))
+        if not keys:
+            return 0
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.delete(*keys)
+        pipe.zrem(index_key, *keys)
+        pipe.execute()
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._series_index.clear()
+            self._series_latest.clear()
+            self._bytes = 0
+
+    def get_stats(self) -> dict:
+        """
+        Hit/miss counters and the dedupe ratio (share of lookups served without computing).
+        """
+        hits = metrics.get_counter('indicator_cache.hits.local') + metrics.get_counter('indicator_cache.hits.redis')
+        misses = metrics.get_counter('indicator_cache.misses')
+        with self._lock:
+            entries, size = len(self._entries), self._bytes
+        return {
+            'hits_local': metrics.get_counter('indicator_cache.hits.local'),
+            'hits_redis': metrics.get_counter('indicator_cache.hits.redis'),
+            'misses': misses,
+            'computes': metrics.get_counter('indicator_cache.computes'),
+            'evictions': metrics.get_counter('indicator_cache.evictions'),
+            'invalidations': metrics.get_counter('indicator_cache.invalidations'),
+            'dedupe_ratio': hits / (hits + misses) if (hits + misses) else 0.0,
+            'entries': entries,
+            'bytes': size,
+        }
+
+
+# نمونه سراسری در سطح پروسس
+indicator_result_cache = IndicatorResultCache()
+
 # --- کلاس‌های کش مبتنی بر مدل ---
 # اگر از مدل CacheEntry در پایگاه داده استفاده می‌کنید، می‌توانید منیجرها و کوئری‌ست‌های مربوطه را در apps/core/managers.py یا همینجا تعریف کنید.
 # مثلاً:
@@ -0,0 +1,266 @@
+# apps/core/fixed_point.py
+
+"""
+Scaled-integer (fixed-point) prices and quantities for hot paths.
+
+A value is carried as an int number of units of 10**-decimals. FixedPointScale picks the
+decimals from an instrument's tick and lot size (InstrumentExchangeMap), so every valid
+price is a multiple of tick_units and every valid quantity a multiple of lot_units:
+tick/lot validation is an integer modulo and rounding is integer division. Conversion
+to and from Decimal is exact and only happens at the API/DB boundaries; aggregation,
+order book, indicator and risk code can work on int64 NumPy arrays of units.
+"""
+
+from decimal import Decimal
+from typing import Iterable, Optional, Sequence, Tuple
+
+import numpy as np
+
+# مقیاس پیش‌فرض (۸ رقم اعشار، دقت بایننس)
+DEFAULT_DECIMALS = 8
+# حداکثر رقم اعشار قابل نمایش (DecimalFieldهای tick/lot با decimal_places=16)
+MAX_DECIMALS = 18
+
+_POWERS = [10 ** exponent for exponent in range(2 * MAX_DECIMALS + 1)]
+# زیر این حد، فاصله دو float کمتر از ربع واحد است و گرد کردن value * 10**decimals دقیق است
+_FLOAT_EXACT_UNITS = 2 ** 50
+_INT64_MAX = np.iinfo(np.int64).max
+
+
+def parse_scaled(value, decimals: int = DEFAULT_DECIMALS) -> int:
+    """
+    Exact fixed-point parse of a decimal string/int/float/Decimal, e.g. '42000.5' -> 4200050000000 (8 decimals).
+    Raises ValueError when the value has more significant decimals than allowed.
+    """
+    kind = type(value)
+    if kind is str:
+        # مسیر سریع: دقیقاً decimals رقم اعشار (قالب معمول قیمت‌های بایننس)
+        if decimals and len(value) > decimals and value[-decimals - 1] == '.':
+            return int(value.replace('.', '', 1))
+    elif kind is int:
+        return value * _POWERS[decimals]
+    elif kind is float:
+        # مسیر سریع اعداد JSON (مثلاً LBank): فقط وقتی نمایش با decimals رقم اعشار یکتا و دقیق است
+        if value - value == 0.0:
+            units = round(value * _POWERS[decimals])
+            if -_FLOAT_EXACT_UNITS < units < _FLOAT_EXACT_UNITS and units / _POWERS[decimals] == value:
+                return units
+        value = repr(value)
+    elif kind is Decimal:
+        return _parse_decimal(value, decimals)
+    else:
+        raise ValueError(f"Not a number: {value!r}")
+    if 'e' in value or 'E' in value:
+        return _parse_decimal(Decimal(value), decimals)
+    whole, _, fraction = value.partition('.')
+    if len(fraction) > decimals:
+        if fraction[decimals:].strip('0'):
+            raise ValueError(f"{value} has more than {decimals} decimals")
+        fraction = fraction[:decimals]
+    if not whole or whole in '+-':
+        whole += '0'
+    return int(whole + fraction + '0' * (decimals - len(fraction)))
+
+
+def _parse_decimal(value: Decimal, decimals: int) -> int:
+    if not value.is_finite():
+        raise ValueError(f"Not a finite number: {value}")
+    scaled = value.scaleb(decimals)
+    if scaled != scaled.to_integral_value():
+        raise ValueError(f"{value} has more than {decimals} decimals")
+    return int(scaled)
+
+
+def scaled_to_decimal(units: Optional[int], decimals: int = DEFAULT_DECIMALS) -> Optional[Decimal]:
+    """
+    Exact Decimal of a fixed-point value (boundary conversion for models/serializers).
+    """
+    if units is None:
+        return None
+    return Decimal(int(units)).scaleb(-decimals)
+
+
+def format_scaled(units: Optional[int], decimals: int = DEFAULT_DECIMALS) -> Optional[str]:
+    """
+    Decimal string of a fixed-point value without building a Decimal, e.g. 4200050000000 -> '42000.50000000'.
+    """
+    if units is None:
+        return None
+    units = int(units)
+    if not decimals:
+        return str(units)
+    sign = '-' if units < 0 else ''
+    whole, fraction = divmod(abs(units), _POWERS[decimals])
+    return f"{sign}{whole}.{fraction:0{decimals}d}"
+
+
+def decimal_places(value) -> int:
+    """
+    Number of significant decimals of a number, e.g. Decimal('0.0100') -> 2, Decimal('5') -> 0.
+    """
+    value = value if isinstance(value, Decimal) else Decimal(str(value))
+    exponent = value.normalize().as_tuple().exponent
+    return max(-exponent, 0) if isinstance(exponent, int) else 0
+
+
+def round_half_up_div(numerator: int, denominator: int) -> int:
+    """
+    Integer division rounded to nearest, halves away from zero (Decimal ROUND_HALF_UP).
+    """
+    quotient, remainder = divmod(abs(numerator), denominator)
+    if 2 * remainder >= denominator:
+        quotient += 1
+    return quotient if numerator >= 0 else -quotient
+
+
+class FixedPointScale:
+    """
+    Price/quantity scale of one instrument on one exchange, derived from its tick and lot size.
+    """
+    __slots__ = ('price_decimals', 'quantity_decimals', 'tick_units', 'lot_units')
+
+    def __init__(self, price_decimals: int = DEFAULT_DECIMALS, quantity_decimals: int = DEFAULT_DECIMALS,
+                 tick_units: int = 1, lot_units: int = 1):
+        if not 0 <= price_decimals <= MAX_DECIMALS or not 0 <= quantity_decimals <= MAX_DECIMALS:
+            raise ValueError(f"Decimals must be between 0 and {MAX_DECIMALS}.")
+        if tick_units <= 0 or lot_units <= 0:
+            raise ValueError("Tick and lot size must be positive.")
+        self.price_decimals = price_decimals
+        self.quantity_decimals = quantity_decimals
+        self.tick_units = tick_units
+        self.lot_units = lot_units
+
+    @classmethod
+    def from_steps(cls, tick_size=None, lot_size=None, min_decimals: int = 0) -> 'FixedPointScale':
+        """
+        Scale whose unit is the finest decimal of tick_size/lot_size (DEFAULT_DECIMALS when unknown).
+        """
+        price_decimals, tick_units = cls._step(tick_size, min_decimals)
+        quantity_decimals, lot_units = cls._step(lot_size, min_decimals)
+        return cls(price_decimals, quantity_decimals, tick_units, lot_units)
+
+    @staticmethod
+    def _step(step, min_decimals: int) -> Tuple[int, int]:
+        if step is None or Decimal(str(step)) <= 0:
+            return max(DEFAULT_DECIMALS, min_decimals), 1
+        step = step if isinstance(step, Decimal) else Decimal(str(step))
+        decimals = max(decimal_places(step), min_decimals)
+        if decimals > MAX_DECIMALS:
+            raise ValueError(f"Step {step} has more than {MAX_DECIMALS} decimals.")
+        return decimals, _parse_decimal(step, decimals)
+
+    @classmethod
+    def for_exchange_map(cls, exchange_map) -> 'FixedPointScale':
+        """
+        Scale of an InstrumentExchangeMap row (tick_size / lot_size).
+        """
+        return cls.from_steps(exchange_map.tick_size, exchange_map.lot_size)
+
+    def __eq__(self, other):
+        return isinstance(other, FixedPointScale) and self.key() == other.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def __repr__(self):
+        return (f"FixedPointScale(tick={self.tick_size}, lot={self.lot_size}, "
+                f"decimals={self.price_decimals}/{self.quantity_decimals})")
+
+    def key(self) -> Tuple[int, int, int, int]:
+        return self.price_decimals, self.quantity_decimals, self.tick_units, self.lot_units
+
+    @property
+    def tick_size(self) -> Decimal:
+        return scaled_to_decimal(self.tick_units, self.price_decimals)
+
+    @property
+    def lot_size(self) -> Decimal:
+        return scaled_to_decimal(self.lot_units, self.quantity_decimals)
+
+    # --- مرز Decimal <-> عدد صحیح (دقیق) ---
+    def price_units(self, value) -> int:
+        return parse_scaled(value, self.price_decimals)
+
+    def quantity_units(self, value) -> int:
+        return parse_scaled(value, self.quantity_decimals)
+
+    def price(self, units: Optional[int]) -> Optional[Decimal]:
+        return scaled_to_decimal(units, self.price_decimals)
+
+    def quantity(self, units: Optional[int]) -> Optional[Decimal]:
+        return scaled_to_decimal(units, self.quantity_decimals)
+
+    def notional(self, price_units: int, quantity_units: int) -> Decimal:
+        """
+        Exact price * quantity as Decimal.
+        """
+        return scaled_to_decimal(int(price_units) * int(quantity_units), self.price_decimals + self.quantity_decimals)
+
+    # --- tick / lot ---
+    def is_valid_price(self, units: int) -> bool:
+        return units % self.tick_units == 0
+
+    def is_valid_quantity(self, units: int) -> bool:
+        return units % self.lot_units == 0
+
+    def round_price(self, units: int) -> int:
+        """
+        Nearest multiple of the tick (halves away from zero).
+        """
+        return round_half_up_div(units, self.tick_units) * self.tick_units
+
+    def floor_quantity(self, units: int) -> int:
+        """
+        Largest multiple of the lot not above the quantity (orders must not exceed the requested size).
+        """
+        return units // self.lot_units * self.lot_units
+
+    # --- آرایه‌های int64 ---
+    def price_array(self, values: Iterable) -> np.ndarray:
+        return np.fromiter((parse_scaled(value, self.price_decimals) for value in values), dtype=np.int64)
+
+    def quantity_array(self, values: Iterable) -> np.ndarray:
+        return np.fromiter((parse_scaled(value, self.quantity_decimals) for value in values), dtype=np.int64)
+
+    def valid_prices(self, units: np.ndarray) -> np.ndarray:
+        return np.asarray(units, dtype=np.int64) % self.tick_units == 0
+
+    def round_prices(self, units: np.ndarray) -> np.ndarray:
+        units = np.asarray(units, dtype=np.int64)
+        ticks = np.abs(units) // self.tick_units
+        ticks += (2 * (np.abs(units) - ticks * self.tick_units) >= self.tick_units)
+        return np.sign(units) * ticks * self.tick_units
+
+    def prices_to_float(self, units: np.ndarray) -> np.ndarray:
+        """
+        float64 view for indicator code that needs floating point (exact up to 2**53 units).
+        """
+        return np.asarray(units, dtype=np.int64) / float(_POWERS[self.price_decimals])
+
+    def quantities_to_float(self, units: np.ndarray) -> np.ndarray:
+        return np.asarray(units, dtype=np.int64) / float(_POWERS[self.quantity_decimals])
+
+    def vwap(self, price_units: Sequence[int], quantity_units: Sequence[int]) -> Optional[Decimal]:
+        """
+        Exact volume-weighted average price of int64 price/quantity arrays, rounded half-up to price decimals.
+        """
+        total_notional = notional_sum(price_units, quantity_units)
+        total_quantity = int(np.sum(np.asarray(quantity_units, dtype=np.int64), dtype=np.int64))
+        if not total_quantity:
+            return None
+        return self.price(round_half_up_div(total_notional, total_quantity))
+
+
+def notional_sum(price_units: Sequence[int], quantity_units: Sequence[int]) -> int:
+    """
+    Exact sum(price * quantity) in units of 10**-(price + quantity decimals).
+    Uses int64 dot products when they cannot overflow, Python ints otherwise.
+    """
+    prices = np.asarray(price_units, dtype=np.int64)
+    quantities = np.asarray(quantity_units, dtype=np.int64)
+    if not len(prices):
+        return 0
+    bound = int(np.abs(prices).max()) * int(np.abs(quantities).max())
+    if bound * len(prices) <= _INT64_MAX:
+        return int(np.dot(prices, quantities))
+    return sum(price * quantity for price, quantity in zip(prices.tolist(), quantities.tolist()))
@@ -11,6 +11,7 @@ from django.utils import timezone
 from django.conf import settings
 from django.core.exceptions import ValidationError
 import json
+from .fixed_point import decimal_places, parse_scaled, round_half_up_div, scaled_to_decimal
 
 logger = logging.getLogger(__name__)
 
@@ -59,12 +60,9 @@ def validate_tick_size(price: Decimal, tick_size: Decimal) -> bool:
     """
     if tick_size <= 0:
         return False
-    # محاسبه باقیمانده تقسیم قیمت بر اندازه تیک
-    remainder = price % tick_size
-    # اگر باقیمانده بسیار کوچک باشد (به دلیل دقت)، معتبر فرض می‌شود
-    # مثلاً اگر باقیمانده کمتر از 1/1000000 تیک بود، معتبر است
-    tolerance = tick_size / Decimal('1000000')
-    return remainder < tolerance
+    # هر دو به عدد صحیح با یک مقیاس مشترک تبدیل می‌شوند؛ اعتبارسنجی یک باقیمانده صحیح و دقیق است
+    decimals = max(decimal_places(price), decimal_places(tick_size))
+    return parse_scaled(price, decimals) % parse_scaled(tick_size, decimals) == 0
 
 
 # --- توابع مربوط به مدیریت IP ---
@@ -165,12 +163,11 @@ def round_to_tick_size(price: Decimal, tick_size: Decimal) -> Decimal:
     """
     if tick_size <= 0:
         raise ValueError("Tick size must be positive.")
-    # تقسیم بر tick_size
-    divided = price / tick_size
-    # گرد کردن به نزدیک‌ترین عدد صحیح
-    rounded_divided = divided.quantize(Decimal('1'), rounding='ROUND_HALF_UP')
-    # ضرب مجدد در tick_size
-    return rounded_divided * tick_size
+    # گرد کردن با تقسیم صحیح روی واحدهای ثابت‌نقطه (ROUND_HALF_UP)
+    tick_decimals = decimal_places(tick_size)
+    decimals = max(decimal_places(price), tick_decimals)
+    ticks = round_half_up_div(parse_scaled(price, decimals), parse_scaled(tick_size, decimals))
+    return scaled_to_decimal(ticks * parse_scaled(tick_size, tick_decimals), tick_decimals)
 
 
 # --- توابع کمکی عمومی ---
@@ -211,7 +208,7 @@ def get_location_from_ip(ip: str) -> str:
     return "Unknown Location"
 
 # --- توابع مربوط به داده‌های بازار (در صورت نیاز به تبدیل واحد یا نرمالایز) ---
-def normalize_data_from_source(raw_ Dict[str, Any], source_name: str, data_type: str) -> Optional[Dict[str, Any]]:
+def normalize_data_from_source(raw_data: Dict[str, Any], source_name: str, data_type: str) -> Optional[Dict[str, Any]]:
     """
     Normalizes raw data from different data sources into a standard format.
     This function maps source-specific field names to a common structure based on the data type.
@@ -303,7 +300,7 @@ def normalize_data_from_source(raw_ Dict[str, Any], source_name: str, data_type:
         logger.error(f"Error normalizing data from {source_name} for {data_type}: {str(e)}. Raw  {raw_data}")
         return None
 
-def validate_ohlcv_data( Dict[str, Any], data_type: str = 'OHLCV') -> Optional[Dict[str, Any]]:
+def validate_ohlcv_data(data: Dict[str, Any], data_type: str = 'OHLCV') -> Optional[Dict[str, Any]]:
     """
     Validates the structure and content of normalized OHLCV data.
     Checks for logical consistency (e.g., Low <= Open <= High).
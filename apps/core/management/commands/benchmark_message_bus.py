@@ -0,0 +1,115 @@
+# apps/core/management/commands/benchmark_message_bus.py
+
+import asyncio
+import time
+from django.core.management.base import BaseCommand
+from apps.core.messaging import MessageBus, get_codec
+from apps.core.metrics import metrics
+
+# پیام نمونه هم‌اندازه یک تیک نرمال‌شده
+SAMPLE_PAYLOAD = {
+    'type': 'MARKET_DATA_UPDATE',
+    'symbol': 'BTCUSDT',
+    'exchange': 'BINANCE',
+    'timestamp': 1700000012344,
+    'price': '37260.55000000',
+    'quantity': '0.00120000',
+    'side': 'SELL',
+    'trade_id': 3262850480,
+}
+
+
+async def _run(broker_type: str, codec: str, count: int, batch: int, consumers: int) -> dict:
+    bus = MessageBus(broker_type=broker_type, codec=get_codec(codec))
+    topic = f"benchmark.{int(time.time() * 1000)}"
+    latency_name = f'core.bus.latency_ms.{topic}'
+    received = 0
+    done = asyncio.Event()
+
+    def handler(message):
+        nonlocal received
+        received += 1
+        if received >= count:
+            done.set()
+
+    for index in range(consumers):
+        await bus.subscribe(topic, handler, group='benchmark', consumer=f'benchmark-{index}')
+    started = time.perf_counter()
+    if batch > 1:
+        for offset in range(0, count, batch):
+            await bus.publish_batch([(topic, SAMPLE_PAYLOAD)] * min(batch, count - offset))
+    else:
+        for _ in range(count):
+            await bus.publish(topic, SAMPLE_PAYLOAD)
+    published = time.perf_counter() - started
+    await asyncio.wait_for(done.wait(), timeout=max(30.0, count / 1000))
+    elapsed = time.perf_counter() - started
+    await bus.close()
+    return {
+        'publish_rate': count / published,
+        'end_to_end_rate': count / elapsed,
+        'latency': metrics.get_distribution(latency_name) or {},
+    }
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the MessageBus: publish and end-to-end throughput (msgs/second) and p99 latency.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--messages',
+            type=int,
+            default=100_000,
+            help='Messages per timed run (default: 100000).',
+        )
+        parser.add_argument(
+            '--batch',
+            type=int,
+            default=100,
+            help='Messages per publish_batch call; 1 publishes one message at a time.',
+        )
+        parser.add_argument(
+            '--backend',
+            choices=['memory', 'redis'],
+            default='memory',
+            help='Bus backend to benchmark (redis needs a reachable Redis server).',
+        )
+        parser.add_argument(
+            '--codec',
+            choices=['msgpack', 'json'],
+            default='msgpack',
+            help='Envelope codec (used by the redis backend only).',
+        )
+        parser.add_argument(
+            '--consumers',
+            type=int,
+            default=1,
+            help='Consumers in the benchmark group.',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=3,
+            help='Number of timed runs; the best one is reported.',
+        )
+
+    def handle(self, *args, **options):
+        count, batch = options['messages'], max(options['batch'], 1)
+        self.stdout.write(
+            f"Backend: {options['backend']} ({options['codec']}); {count:,} messages per run, "
+            f"batch {batch}, {options['consumers']} consumer(s)."
+        )
+        best = None
+        for _ in range(max(options['repeat'], 1)):
+            result = asyncio.run(_run(options['backend'], options['codec'], count, batch, options['consumers']))
+            if best is None or result['end_to_end_rate'] > best['end_to_end_rate']:
+                best = result
+
+        latency = best['latency']
+        metrics.gauge(f"core.bus.benchmark.{options['backend']}.msgs_per_second", best['end_to_end_rate'])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"publish {best['publish_rate']:,.0f} msgs/s | end-to-end {best['end_to_end_rate']:,.0f} msgs/s | "
+                f"latency p50 {latency.get('p50', 0):.2f} ms, p99 {latency.get('p99', 0):.2f} ms"
+            )
+        )
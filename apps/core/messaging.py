@@ -1,15 +1,75 @@
 # apps/core/messaging.py
 
+"""
+Message bus for inter-agent communication within the MAS.
+
+One async MessageBus with two transports:
+  - 'memory': zero-copy in-process delivery for agents in the same process; the published
+    Message object itself is handed to every consumer group (one bounded asyncio.Queue per
+    group, so publishers get backpressure instead of unbounded growth). Messages for topics
+    without a consumer group in the process are dropped and counted in core.bus.dropped,
+  - 'redis' (default, MESSAGE_BUS_BACKEND): Redis Streams with consumer groups. Batches are published in one pipelined
+    round trip (XADD per message, MAXLEN ~ trimmed); consumers of the same group share the
+    stream (load-balanced) and acknowledge after the handler succeeds, so delivery is
+    at-least-once. Messages left pending by a crashed consumer are claimed by another one
+    after claim_idle_ms; after max_deliveries attempts they move to '<stream>:dead'.
+Envelopes are msgpack arrays (JSON when msgpack is not installed). Per-topic counters,
+publish-to-handler latency (p50/p95/p99 via metrics.get_distribution) and consumer group lag
+are recorded in apps.core.metrics under 'core.bus.*'.
+"""
+
+import asyncio
+import inspect
 import json
 import logging
-from typing import Dict, Any, Optional, Callable, List
+import threading
+import time
+import uuid
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
 from django.conf import settings
-from django.utils import timezone
-from .exceptions import CoreSystemException, MessagingError # فرض بر این است که این استثناها وجود دارند
-from .models import AuditLog # فرض بر این است که مدل AuditLog وجود دارد
+from django.utils.translation import gettext_lazy as _
+
+from .exceptions import CoreSystemException
+from .metrics import metrics
+
+try:
+    import msgpack
+except ImportError:
+    # msgpack اختیاری است؛ در نبود آن envelope با JSON کد می‌شود
+    msgpack = None
+
+try:
+    import redis
+    import redis.asyncio as redis_asyncio
+except ImportError:
+    # redis فقط برای بک‌اند 'redis' لازم است
+    redis = None
+    redis_asyncio = None
 
 logger = logging.getLogger(__name__)
 
+METRIC_PREFIX = 'core.bus'
+
+BACKEND_MEMORY = 'memory'
+BACKEND_REDIS = 'redis'
+DEFAULT_GROUP = 'default'
+
+# تنظیمات پیش‌فرض؛ settings.MESSAGE_BUS آن‌ها را بازنویسی می‌کند
+DEFAULT_MESSAGE_BUS = {
+    'queue_size': 10000,            # ظرفیت صف هر گروه مصرف‌کننده در بک‌اند memory
+    'stream_maxlen': 100000,        # حداکثر تقریبی طول هر stream در Redis
+    'key_prefix': 'bus:',
+    'batch_size': 100,              # حداکثر پیام در هر خواندن مصرف‌کننده
+    'block_ms': 1000,
+    'claim_idle_ms': 30000,         # پیام‌های pending بیکارتر از این به مصرف‌کننده دیگر داده می‌شوند
+    'max_deliveries': 5,            # پس از این تعداد تحویل ناموفق، پیام به dead-letter می‌رود
+    'lag_interval_seconds': 5.0,
+}
+
+
 # --- استثناهای مرتبط با پیام‌رسانی ---
 class MessagingError(CoreSystemException):
     """
@@ -43,189 +103,561 @@ class MessageParseError(MessagingError):
     default_detail = _('Failed to parse received message.')
     default_code = 'message_parse_error'
 
-# --- ابزار اصلی: MessageBus ---
-class MessageBus:
+
+def get_message_bus_settings() -> Dict[str, Any]:
+    merged = dict(DEFAULT_MESSAGE_BUS)
+    merged.update(getattr(settings, 'MESSAGE_BUS', {}) or {})
+    return merged
+
+
+# --- پیام و کدک ---
+class Message:
     """
-    Central hub for inter-agent communication within the MAS.
-    This class provides a unified interface for publishing and subscribing to messages/events.
-    It abstracts the underlying message broker (e.g., Redis, RabbitMQ, Celery).
+    Bus envelope; timestamp_ms is the publish time (epoch ms) used for end-to-end latency.
     """
-    def __init__(self, broker_type: str = 'redis'):
+    __slots__ = ('topic', 'payload', 'message_type', 'sender_id', 'correlation_id', 'message_id',
+                 'timestamp_ms', 'delivery_id', 'delivery_count')
+
+    def __init__(self, topic: str, payload: Any, message_type: Optional[str] = None, sender_id: Optional[str] = None,
+                 correlation_id: Optional[str] = None, message_id: Optional[str] = None,
+                 timestamp_ms: Optional[float] = None):
+        self.topic = topic
+        self.payload = payload
+        self.message_type = message_type
+        self.sender_id = sender_id
+        self.correlation_id = correlation_id
+        self.message_id = message_id or uuid.uuid4().hex
+        self.timestamp_ms = time.time() * 1000 if timestamp_ms is None else timestamp_ms
+        self.delivery_id = None   # شناسه پیام در stream (برای ack)
+        self.delivery_count = 1
+
+    def __repr__(self):
+        return f"Message({self.topic!r}, type={self.message_type!r}, id={self.message_id})"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'topic': self.topic,
+            'message': self.payload,
+            'message_type': self.message_type,
+            'sender_id': self.sender_id,
+            'correlation_id': self.correlation_id,
+            'message_id': self.message_id,
+            'timestamp_ms': self.timestamp_ms,
+        }
+
+
+def _encode_default(value):
+    # انواع رایج payloadها که msgpack/JSON مستقیماً نمی‌شناسند
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    raise TypeError(f"Cannot encode {type(value).__name__} in a bus message")
+
+
+class JsonCodec:
+    name = 'json'
+
+    def encode(self, message: Message) -> bytes:
+        return json.dumps(
+            [message.message_id, message.topic, message.message_type, message.sender_id,
+             message.correlation_id, message.timestamp_ms, message.payload],
+            default=_encode_default, separators=(',', ':'),
+        ).encode()
+
+    def decode(self, data: bytes) -> Message:
+        try:
+            fields = self._loads(data)
+            message_id, topic, message_type, sender_id, correlation_id, timestamp_ms, payload = fields
+        except (ValueError, TypeError) as e:
+            raise MessageParseError(f"Invalid bus message: {e}")
+        return Message(topic, payload, message_type, sender_id, correlation_id, message_id, timestamp_ms)
+
+    @staticmethod
+    def _loads(data: bytes):
+        return json.loads(data)
+
+
+class MsgpackCodec(JsonCodec):
+    name = 'msgpack'
+
+    def encode(self, message: Message) -> bytes:
+        return msgpack.packb(
+            (message.message_id, message.topic, message.message_type, message.sender_id,
+             message.correlation_id, message.timestamp_ms, message.payload),
+            default=_encode_default, use_bin_type=True,
+        )
+
+    @staticmethod
+    def _loads(data: bytes):
+        try:
+            return msgpack.unpackb(data, raw=False)
+        except (msgpack.ExtraData, msgpack.FormatError, msgpack.StackError) as e:
+            raise ValueError(str(e))
+
+
+def get_codec(name: Optional[str] = None):
+    name = name or getattr(settings, 'MESSAGE_BUS_CODEC', 'msgpack')
+    if name == 'msgpack' and msgpack is not None:
+        return MsgpackCodec()
+    if name not in ('msgpack', 'json'):
+        raise ValueError(f"Unsupported message codec: {name}")
+    return JsonCodec()
+
+
+# --- بک‌اند درون‌پروسسی (zero-copy) ---
+class InProcessTransport:
+    """
+    Topic -> consumer group -> bounded asyncio.Queue; the same Message object reaches every group.
+    """
+    zero_copy = True
+
+    def __init__(self, queue_size: int = DEFAULT_MESSAGE_BUS['queue_size']):
+        self.queue_size = queue_size
+        self._groups: Dict[str, Dict[str, asyncio.Queue]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def ensure_group(self, topic: str, group: str):
+        self._loop = asyncio.get_running_loop()
+        self._groups.setdefault(topic, {}).setdefault(group, asyncio.Queue(maxsize=self.queue_size))
+
+    async def publish(self, messages: List[Message]) -> None:
+        unrouted = []
+        for message in messages:
+            queues = self._groups.get(message.topic)
+            if not queues:
+                unrouted.append(message)
+                continue
+            for queue in queues.values():
+                await queue.put(message)
+        if unrouted:
+            self._dropped(unrouted, 'no consumer group in this process')
+
+    def publish_nowait(self, messages: List[Message]) -> int:
         """
-        Initializes the MessageBus with a specific broker.
-        Args:
-            broker_type: The type of broker to use ('redis', 'rabbitmq', 'celery', 'memory').
+        Sync publish (any thread); messages that do not fit in a full group queue are dropped.
+        Returns how many messages were routed; messages of topics without a consumer group in
+        this process (or sent before any subscriber started) are dropped and counted.
         """
-        self.broker_type = broker_type
-        self._broker_instance = self._initialize_broker()
-        logger.info(f"MessageBus initialized with broker type: {broker_type}")
+        if self._loop is None or self._loop.is_closed():
+            self._dropped(messages, 'no subscriber event loop in this process')
+            return 0
+        try:
+            on_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            on_loop = False
+        if not on_loop:
+            self._loop.call_soon_threadsafe(self.publish_nowait, messages)
+            return len(messages)
+        dropped, unrouted = 0, []
+        for message in messages:
+            queues = self._groups.get(message.topic)
+            if not queues:
+                unrouted.append(message)
+                continue
+            for queue in queues.values():
+                try:
+                    queue.put_nowait(message)
+                except asyncio.QueueFull:
+                    dropped += 1
+        if dropped:
+            metrics.incr(f'{METRIC_PREFIX}.dropped', dropped)
+        if unrouted:
+            self._dropped(unrouted, 'no consumer group in this process')
+        return len(messages) - len(unrouted)
+
+    @staticmethod
+    def _dropped(messages: List[Message], reason: str):
+        # بک‌اند memory فقط مصرف‌کننده‌های همین پروسس را می‌بیند؛ بین پروسس‌ها باید 'redis' باشد
+        metrics.incr(f'{METRIC_PREFIX}.dropped', len(messages))
+        topics = sorted({message.topic for message in messages})
+        logger.warning(f"In-process bus dropped {len(messages)} messages ({reason}): topics {', '.join(topics)}.")
+
+    async def consume(self, topic: str, group: str, consumer: str, batch_size: int, block_ms: int) -> List[Message]:
+        queue = self._groups[topic][group]
+        try:
+            first = await asyncio.wait_for(queue.get(), timeout=block_ms / 1000)
+        except asyncio.TimeoutError:
+            return []
+        batch = [first]
+        while len(batch) < batch_size and not queue.empty():
+            batch.append(queue.get_nowait())
+        return batch
+
+    async def ack(self, topic: str, group: str, messages: List[Message]) -> None:
+        # تحویل درون‌پروسسی at-most-once است؛ چیزی برای ack وجود ندارد
+        return None
+
+    async def reclaim(self, topic: str, group: str, consumer: str, batch_size: int) -> List[Message]:
+        return []
+
+    async def lag(self, topic: str, group: str) -> int:
+        queue = self._groups.get(topic, {}).get(group)
+        return queue.qsize() if queue is not None else 0
+
+    async def close(self) -> None:
+        self._groups.clear()
+
+
+# --- بک‌اند Redis Streams ---
+class RedisStreamTransport:
+    """
+    Redis Streams with consumer groups: pipelined XADD, XREADGROUP, XACK, pending reclaim and dead-letter.
+    """
+    zero_copy = False
+    FIELD = b'm'
+
+    def __init__(self, codec=None, options: Optional[Dict[str, Any]] = None, client=None, sync_client=None):
+        self.codec = codec or get_codec()
+        self.options = options or get_message_bus_settings()
+        self._client = client
+        self._sync_client = sync_client
+
+    @staticmethod
+    def _connection_kwargs() -> Dict[str, Any]:
+        return {
+            'host': getattr(settings, 'REDIS_HOST', 'localhost'),
+            'port': getattr(settings, 'REDIS_PORT', 6379),
+            'db': getattr(settings, 'REDIS_DB', 0),
+        }
+
+    @property
+    def client(self):
+        if self._client is None:
+            if redis_asyncio is None:
+                raise MessagingError("Redis library not found.")
+            self._client = redis_asyncio.Redis(**self._connection_kwargs())
+        return self._client
+
+    @property
+    def sync_client(self):
+        if self._sync_client is None:
+            if redis is None:
+                raise MessagingError("Redis library not found.")
+            self._sync_client = redis.Redis(**self._connection_kwargs())
+        return self._sync_client
 
-    def _initialize_broker(self):
+    def key(self, topic: str) -> str:
+        return f"{self.options['key_prefix']}{topic}"
+
+    def _entries(self, messages: List[Message]) -> List[Tuple[str, Dict[bytes, bytes]]]:
+        return [(self.key(message.topic), {self.FIELD: self.codec.encode(message)}) for message in messages]
+
+    async def ensure_group(self, topic: str, group: str):
+        try:
+            await self.client.xgroup_create(self.key(topic), group, id='$', mkstream=True)
+        except Exception as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    async def publish(self, messages: List[Message]) -> None:
+        # یک رفت‌وبرگشت برای کل batch
+        pipe = self.client.pipeline(transaction=False)
+        for key, fields in self._entries(messages):
+            pipe.xadd(key, fields, maxlen=self.options['stream_maxlen'], approximate=True)
+        await pipe.execute()
+
+    def publish_nowait(self, messages: List[Message]) -> int:
+        pipe = self.sync_client.pipeline(transaction=False)
+        for key, fields in self._entries(messages):
+            pipe.xadd(key, fields, maxlen=self.options['stream_maxlen'], approximate=True)
+        pipe.execute()
+        return len(messages)
+
+    def _decode_entries(self, entries, delivery_count: int = 1) -> List[Message]:
+        messages = []
+        for entry_id, fields in entries:
+            data = fields.get(self.FIELD) if fields else None
+            if data is None:
+                continue
+            try:
+                message = self.codec.decode(data)
+            except MessageParseError as e:
+                logger.error(f"Skipping undecodable bus entry {entry_id!r}: {e}")
+                continue
+            message.delivery_id = entry_id
+            message.delivery_count = delivery_count
+            messages.append(message)
+        return messages
+
+    async def consume(self, topic: str, group: str, consumer: str, batch_size: int, block_ms: int) -> List[Message]:
+        response = await self.client.xreadgroup(group, consumer, {self.key(topic): '>'}, count=batch_size, block=block_ms)
+        messages = []
+        for _stream, entries in response or []:
+            messages.extend(self._decode_entries(entries))
+        return messages
+
+    async def ack(self, topic: str, group: str, messages: List[Message]) -> None:
+        ids = [message.delivery_id for message in messages if message.delivery_id is not None]
+        if ids:
+            await self.client.xack(self.key(topic), group, *ids)
+
+    async def reclaim(self, topic: str, group: str, consumer: str, batch_size: int) -> List[Message]:
         """
-        Initializes the specific broker instance based on the broker_type.
+        Claims messages pending longer than claim_idle_ms; dead-letters those delivered max_deliveries times.
         """
-        if self.broker_type == 'redis':
+        key = self.key(topic)
+        idle = self.options['claim_idle_ms']
+        pending = await self.client.xpending_range(key, group, min='-', max='+', count=batch_size, idle=idle)
+        if not pending:
+            return []
+        dead = [entry['message_id'] for entry in pending if entry['times_delivered'] >= self.options['max_deliveries']]
+        retry = {entry['message_id']: entry['times_delivered'] + 1 for entry in pending
+                 if entry['times_delivered'] < self.options['max_deliveries']}
+        if dead:
+            entries = await self.client.xclaim(key, group, consumer, idle, dead)
+            pipe = self.client.pipeline(transaction=False)
+            for _entry_id, fields in entries:
+                if fields:
+                    pipe.xadd(f"{key}:dead", fields, maxlen=self.options['stream_maxlen'], approximate=True)
+            pipe.xack(key, group, *dead)
+            await pipe.execute()
+            metrics.incr(f'{METRIC_PREFIX}.dead_lettered.{topic}', len(dead))
+        if not retry:
+            return []
+        claimed = await self.client.xclaim(key, group, consumer, idle, list(retry))
+        messages = self._decode_entries(claimed)
+        for message in messages:
+            message.delivery_count = retry.get(message.delivery_id, message.delivery_count)
+        metrics.incr(f'{METRIC_PREFIX}.reclaimed.{topic}', len(messages))
+        return messages
+
+    async def lag(self, topic: str, group: str) -> int:
+        for info in await self.client.xinfo_groups(self.key(topic)):
+            name = info.get('name')
+            if (name.decode() if isinstance(name, bytes) else name) == group:
+                # Redis 7+ طول عقب‌ماندگی را مستقیماً گزارش می‌کند؛ در نسخه‌های قدیمی‌تر تعداد pending
+                lag = info.get('lag')
+                return int(lag if lag is not None else info.get('pending', 0))
+        return 0
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        if self._sync_client is not None:
+            self._sync_client.close()
+            self._sync_client = None
+
+
+# --- bus ---
+Handler = Callable[[Message], Union[None, Awaitable[None]]]
+
+
+class Subscription:
+    """
+    One consumer of a (topic, group): reads batches, runs the handler, acks successes.
+    """
+
+    def __init__(self, bus: 'MessageBus', topic: str, handler: Handler, group: str, consumer: str,
+                 batch_size: int, block_ms: int):
+        self.bus = bus
+        self.topic = topic
+        self.handler = handler
+        self.group = group
+        self.consumer = consumer
+        self.batch_size = batch_size
+        self.block_ms = block_ms
+        self._is_async = inspect.iscoroutinefunction(handler)
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {'delivered': 0, 'errors': 0}
+
+    async def start(self) -> 'Subscription':
+        await self.bus.transport.ensure_group(self.topic, self.group)
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def _run(self):
+        transport = self.bus.transport
+        lag_interval = self.bus.options['lag_interval_seconds']
+        next_lag = 0.0
+        while True:
             try:
-                import redis
-                redis_host = getattr(settings, 'REDIS_HOST', 'localhost')
-                redis_port = getattr(settings, 'REDIS_PORT', 6379)
-                redis_db = getattr(settings, 'REDIS_DB', 0)
-                r = redis.Redis(host=redis_host, port=redis_port, db=redis_db, decode_responses=True)
-                return r
-            except ImportError:
-                logger.error("Redis library not installed. Install 'redis' package.")
-                raise MessagingError("Redis library not found.")
-        elif self.broker_type == 'rabbitmq':
-            # مثال: استفاده از pika
-            # try:
-            #     import pika
-            #     connection_params = pika.ConnectionParameters(host=settings.RABBITMQ_HOST)
-            #     connection = pika.BlockingConnection(connection_params)
-            #     channel = connection.channel()
-            #     return channel
-            # except ImportError:
-            #     logger.error("Pika library not installed. Install 'pika' package.")
-            #     raise MessagingError("Pika library not found.")
-            logger.warning("RabbitMQ broker initialization is not fully implemented in this example.")
-            return None # یا ایجاد یک استثنا
-        elif self.broker_type == 'celery':
-            # مثال: استفاده از Celery Tasks به عنوان مکانیزم پیام‌رسانی
-            # می‌توانید یک تاسک ساده برای ارسال پیام تعریف کنید و از `delay` یا `apply_async` استفاده کنید
-            # from .tasks import dispatch_message_task
-            # self._dispatch_task = dispatch_message_task.delay
-            logger.warning("Celery broker implementation as a message bus is not fully shown here. Typically, dedicated tasks are used.")
-            return None # یا ارجاع به یک تابع/تاسک Celery
-        elif self.broker_type == 'memory': # برای تست یا توسعه
-            import threading
-            self._in_memory_queue = {}
-            self._locks = {}
-            return self._in_memory_queue
-        else:
-            raise MessagingError(f"Unsupported broker type: {self.broker_type}")
+                now = time.monotonic()
+                if now >= next_lag:
+                    next_lag = now + lag_interval
+                    metrics.gauge(f'{METRIC_PREFIX}.lag.{self.topic}.{self.group}', await transport.lag(self.topic, self.group))
+                    batch = await transport.reclaim(self.topic, self.group, self.consumer, self.batch_size)
+                    if batch:
+                        await self._handle(batch)
+                batch = await transport.consume(self.topic, self.group, self.consumer, self.batch_size, self.block_ms)
+                if batch:
+                    await self._handle(batch)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # خطای بک‌اند (مثلاً قطع Redis)؛ پس از مکث کوتاه دوباره تلاش می‌شود
+                logger.error(f"Bus consumer {self.consumer} of {self.topic}/{self.group} failed: {e}")
+                metrics.incr(f'{METRIC_PREFIX}.consumer_errors')
+                await asyncio.sleep(1.0)
+
+    async def _handle(self, batch: List[Message]):
+        done = []
+        for message in batch:
+            try:
+                if self._is_async:
+                    await self.handler(message)
+                else:
+                    self.handler(message)
+            except Exception as e:
+                # بدون ack؛ در Redis پس از claim_idle_ms دوباره تحویل داده می‌شود
+                self.stats['errors'] += 1
+                metrics.incr(f'{METRIC_PREFIX}.errors.{self.topic}')
+                logger.error(f"Handler for {self.topic}/{self.group} failed on {message.message_id}: {e}")
+                continue
+            done.append(message)
+            metrics.observe(f'{METRIC_PREFIX}.latency_ms.{self.topic}', time.time() * 1000 - message.timestamp_ms)
+        if done:
+            await self.bus.transport.ack(self.topic, self.group, done)
+            self.stats['delivered'] += len(done)
+            metrics.incr(f'{METRIC_PREFIX}.delivered.{self.topic}', len(done))
 
-    def publish(self, topic: str, message_ Dict[str, Any], sender_id: Optional[str] = None):
+
+class MessageBus:
+    """
+    Central hub for inter-agent communication within the MAS: async publish/subscribe over a transport.
+    """
+
+    def __init__(self, broker_type: Optional[str] = None, transport=None, codec=None, options: Optional[Dict[str, Any]] = None):
+        self.options = options or get_message_bus_settings()
+        if transport is None:
+            broker_type = broker_type or getattr(settings, 'MESSAGE_BUS_BACKEND', BACKEND_REDIS)
+            if broker_type == BACKEND_MEMORY:
+                # همه MessageBusهای یک پروسس یک بک‌اند درون‌پروسسی مشترک دارند
+                transport = get_local_transport()
+            elif broker_type == BACKEND_REDIS:
+                transport = RedisStreamTransport(codec=codec, options=self.options)
+            else:
+                raise ValueError(f"Unsupported broker type: {broker_type}")
+        self.broker_type = broker_type
+        self.transport = transport
+        self._subscriptions: List[Subscription] = []
+
+    @staticmethod
+    def _message(topic: str, payload: Any, message_type: Optional[str], sender_id: Optional[str],
+                 correlation_id: Optional[str]) -> Message:
+        if correlation_id is None and isinstance(payload, dict):
+            correlation_id = payload.get('correlation_id')
+        return Message(topic, payload, message_type, sender_id, correlation_id)
+
+    def _published(self, messages: List[Message]):
+        counts: Dict[str, int] = {}
+        for message in messages:
+            counts[message.topic] = counts.get(message.topic, 0) + 1
+        for topic, count in counts.items():
+            metrics.incr(f'{METRIC_PREFIX}.published.{topic}', count)
+
+    async def publish(self, topic: str, payload: Any, message_type: Optional[str] = None,
+                      sender_id: Optional[str] = None, correlation_id: Optional[str] = None) -> str:
         """
-        Publishes a message to a specific topic/channel.
-        Args:
-            topic: The topic to publish the message to.
-            message_: The message payload (dictionary).
-            sender_id: Optional ID of the agent sending the message.
+        Publishes one message; returns its message_id.
         """
+        message = self._message(topic, payload, message_type, sender_id, correlation_id)
         try:
-            envelope = {
-                'topic': topic,
-                'message': message_,
-                'sender_id': sender_id,
-                'timestamp': timezone.now().isoformat(),
-                'correlation_id': message_.get('correlation_id', None) # برای ردیابی درخواست/پاسخ
-            }
-            serialized_envelope = json.dumps(envelope)
-
-            if self.broker_type == 'redis':
-                self._broker_instance.publish(topic, serialized_envelope)
-                logger.debug(f"Message published to Redis topic '{topic}' by sender '{sender_id}'.")
-            elif self.broker_type == 'rabbitmq':
-                 # مثال برای RabbitMQ
-                 # self._broker_instance.basic_publish(exchange='', routing_key=topic, body=serialized_envelope)
-                 # logger.debug(f"Message published to RabbitMQ queue '{topic}' by sender '{sender_id}'.")
-                 pass # پیاده‌سازی RabbitMQ
-            elif self.broker_type == 'memory':
-                # ارسال پیام به صف حافظه (ساده‌شده)
-                if topic not in self._broker_instance:
-                    self._broker_instance[topic] = []
-                self._broker_instance[topic].append(serialized_envelope)
-                logger.debug(f"Message published to in-memory topic '{topic}' by sender '{sender_id}'.")
-            # ... سایر بروکرها
-
-            # ثبت در حسابرسی (اختیاری)
-            # AuditLog.objects.create(
-            #     user=None, # ممکن است نیاز به تعریف کاربر مجازی یا نمایندگی عامل باشد
-            #     action='MESSAGE_PUBLISHED',
-            #     target_model='MessageBus',
-            #     target_id=None,
-            #     details={'topic': topic, 'sender_id': sender_id},
-            #     ip_address='N/A', # یا IP عامل
-            #     user_agent='MAS_Agent',
-            # )
+            await self.transport.publish([message])
+        except Exception as e:
+            logger.error(f"Error publishing message to topic '{topic}': {str(e)}")
+            raise MessageSendError(f"Failed to publish message to topic '{topic}': {str(e)}")
+        self._published([message])
+        return message.message_id
 
+    async def publish_batch(self, items: Iterable[Tuple[str, Any]], message_type: Optional[str] = None,
+                            sender_id: Optional[str] = None) -> List[str]:
+        """
+        Publishes (topic, payload) pairs in one transport call (one pipelined round trip on Redis).
+        """
+        messages = [self._message(topic, payload, message_type, sender_id, None) for topic, payload in items]
+        if not messages:
+            return []
+        try:
+            await self.transport.publish(messages)
+        except Exception as e:
+            logger.error(f"Error publishing a batch of {len(messages)} messages: {str(e)}")
+            raise MessageSendError(f"Failed to publish a batch of {len(messages)} messages: {str(e)}")
+        self._published(messages)
+        return [message.message_id for message in messages]
+
+    def publish_sync(self, topic: str, payload: Any, message_type: Optional[str] = None,
+                     sender_id: Optional[str] = None, correlation_id: Optional[str] = None) -> str:
+        """
+        Publish from synchronous code (Celery tasks, threads) without an event loop.
+        The message_id is returned even when the in-process backend dropped the message
+        (counted in core.bus.dropped); only routed messages count as published.
+        """
+        message = self._message(topic, payload, message_type, sender_id, correlation_id)
+        try:
+            routed = self.transport.publish_nowait([message])
         except Exception as e:
             logger.error(f"Error publishing message to topic '{topic}': {str(e)}")
             raise MessageSendError(f"Failed to publish message to topic '{topic}': {str(e)}")
+        if routed:
+            self._published([message])
+        return message.message_id
 
-    def subscribe(self, topic: str, handler: Callable[[Dict[str, Any]], None]):
+    async def broadcast(self, payload: Any, sender_id: Optional[str] = None, exclude_senders: Optional[List[str]] = None):
         """
-        Subscribes a handler function to a specific topic.
-        The handler will be called when a message arrives on the topic.
-        This is a simplified example, often requiring async processing (e.g., using asyncio or threads).
-        Args:
-            topic: The topic to subscribe to.
-            handler: The function to call when a message is received.
+        Publishes to the 'broadcast' topic unless the sender is excluded.
         """
-        if self.broker_type == 'redis':
-            try:
-                import redis
-                pubsub = self._broker_instance.pubsub()
-                pubsub.subscribe(topic)
-
-                logger.info(f"Subscribed to Redis topic '{topic}'.")
-
-                for message in pubsub.listen():
-                    if message['type'] == 'message':
-                        try:
-                            envelope_str = message['data']
-                            envelope = json.loads(envelope_str)
-                            deserialized_message = envelope['message']
-                            sender_id = envelope.get('sender_id')
-                            logger.debug(f"Message received from topic '{topic}' by handler (sender: {sender_id}).")
-                            handler(deserialized_message)
-                        except json.JSONDecodeError as je:
-                            logger.error(f"Failed to parse message from topic '{topic}': {str(je)}")
-                            raise MessageParseError(f"Failed to parse message from topic '{topic}': {str(je)}")
-                        except Exception as e:
-                            logger.error(f"Error processing message from topic '{topic}': {str(e)}")
-                            # ممکن است بخواهید خطایی را گزارش دهید یا دوباره بالا بیاورید
-                            # raise MessageReceiveError(f"Error in handler for topic '{topic}': {str(e)}")
-            except Exception as e:
-                logger.error(f"Error in Redis subscription for topic '{topic}': {str(e)}")
-                raise MessageReceiveError(f"Failed to subscribe or receive from topic '{topic}': {str(e)}")
-
-        elif self.broker_type == 'memory':
-            # ساده‌ترین پیاده‌سازی برای تست: گوش دادن به یک صف حافظه
-            # این فقط یک مثال است و برای محصول نباید استفاده شود
-            import time
-            while True:
-                if topic in self._broker_instance and self._broker_instance[topic]:
-                    msg_str = self._broker_instance[topic].pop(0) # FIFO
-                    try:
-                        envelope = json.loads(msg_str)
-                        deserialized_message = envelope['message']
-                        sender_id = envelope.get('sender_id')
-                        logger.debug(f"Message received from in-memory topic '{topic}' by handler (sender: {sender_id}).")
-                        handler(deserialized_message)
-                    except json.JSONDecodeError as je:
-                        logger.error(f"Failed to parse message from in-memory topic '{topic}': {str(je)}")
-                        raise MessageParseError(f"Failed to parse message from in-memory topic '{topic}': {str(je)}")
-                    except Exception as e:
-                        logger.error(f"Error processing message from in-memory topic '{topic}': {str(e)}")
-                        # raise MessageReceiveError(f"Error in handler for in-memory topic '{topic}': {str(e)}")
-                time.sleep(0.1) # polling delay
-        # ... سایر بروکرها (مثل RabbitMQ)
-
-    def broadcast(self, message_ Dict[str, Any], sender_id: Optional[str] = None, exclude_senders: Optional[List[str]] = None):
+        if sender_id in (exclude_senders or []):
+            logger.debug(f"Broadcast skipped for sender {sender_id} as it's in the exclusion list.")
+            return None
+        return await self.publish('broadcast', payload, sender_id=sender_id)
+
+    async def subscribe(self, topic: str, handler: Handler, group: str = DEFAULT_GROUP,
+                        consumer: Optional[str] = None, batch_size: Optional[int] = None,
+                        block_ms: Optional[int] = None) -> Subscription:
         """
-        Broadcasts a message to all connected agents.
-        This might be implemented by sending to a special 'broadcast' topic
-        or by iterating through known subscribers (more complex).
-        For this example, we'll publish to a 'broadcast' topic.
+        Starts a consumer; consumers sharing a group split the topic's messages between them,
+        each group receives every message. The handler gets the Message (payload in .payload).
         """
-        if exclude_senders is None:
-            exclude_senders = []
-        # اگر sender_id در لیست استثناها بود، ارسال نکن
-        if sender_id in exclude_senders:
-             logger.debug(f"Broadcast skipped for sender {sender_id} as it's in the exclusion list.")
-             return
+        subscription = Subscription(
+            self, topic, handler, group, consumer or f"{group}-{uuid.uuid4().hex[:8]}",
+            batch_size or self.options['batch_size'], block_ms or self.options['block_ms'],
+        )
+        await subscription.start()
+        self._subscriptions.append(subscription)
+        logger.info(f"Subscribed {subscription.consumer} to topic '{topic}' (group {group}).")
+        return subscription
+
+    async def close(self):
+        for subscription in self._subscriptions:
+            await subscription.stop()
+        self._subscriptions.clear()
+        if not self.transport.zero_copy:
+            await self.transport.close()
+
+    def get_stats(self, topic: Optional[str] = None) -> Dict[str, Any]:
+        if topic is None:
+            return metrics.get_stats(f'{METRIC_PREFIX}.')
+        return {
+            'published': metrics.get_stats(f'{METRIC_PREFIX}.published.{topic}'),
+            'delivered': metrics.get_stats(f'{METRIC_PREFIX}.delivered.{topic}'),
+            'latency_ms': metrics.get_distribution(f'{METRIC_PREFIX}.latency_ms.{topic}'),
+        }
+
 
-        self.publish('broadcast', message_, sender_id)
+_local_transport: Optional[InProcessTransport] = None
+_local_transport_lock = threading.Lock()
+
+
+def get_local_transport() -> InProcessTransport:
+    global _local_transport
+    with _local_transport_lock:
+        if _local_transport is None:
+            _local_transport = InProcessTransport(get_message_bus_settings()['queue_size'])
+        return _local_transport
 
 
 # --- کلاس پایه برای عامل‌ها ---
@@ -240,44 +672,38 @@ class BaseAgent:
         self.agent_id = agent_config.get('id', 'generic_agent')
         self.subscribed_topics = set()
 
-    def send_message(self, topic: str, message_ Dict[str, Any]):
+    async def send_message(self, topic: str, message: Dict[str, Any]):
         """
         Sends a message via the message bus.
         """
         try:
-            self.message_bus.publish(topic, message, sender_id=self.agent_id)
+            await self.message_bus.publish(topic, message, sender_id=self.agent_id)
         except MessagingError as e:
             logger.error(f"Agent {self.agent_id} failed to send message: {str(e)}")
             # منطق مدیریت خطا مانند تلاش مجدد
             raise
 
-    def broadcast_message(self, message_ Dict[str, Any], exclude_self: bool = True):
+    async def broadcast_message(self, message: Dict[str, Any], exclude_self: bool = True):
         """
         Broadcasts a message to all agents.
         """
         exclude_list = [self.agent_id] if exclude_self else []
-        self.message_bus.broadcast(message, sender_id=self.agent_id, exclude_senders=exclude_list)
+        await self.message_bus.broadcast(message, sender_id=self.agent_id, exclude_senders=exclude_list)
 
-    def subscribe_to_topic(self, topic: str, handler: Callable[[Dict[str, Any]], None]):
+    async def subscribe_to_topic(self, topic: str, handler: Callable[[Dict[str, Any]], None]):
         """
-        Subscribes the agent to a specific topic.
+        Subscribes the agent to a specific topic (one consumer group per agent).
         """
-        # ممکن است نیاز به ذخیره handler در یک لیست داخلی داشته باشیم برای مدیریت اشتراک
-        # یا اینکه فقط به MessageBus دستور دهیم که اشتراک را مدیریت کند
-        # در این مثال، فقط MessageBus اشتراک را مدیریت می‌کند
         self.subscribed_topics.add(topic)
-        self.message_bus.subscribe(topic, handler)
+        return await self.message_bus.subscribe(topic, lambda message: handler(message.payload), group=str(self.agent_id))
 
     def start_listening(self):
         """
-        Starts the agent's listening loop (often implemented asynchronously).
-        This is a placeholder; actual implementation depends heavily on the broker.
+        Subscriptions start consuming as soon as subscribe_to_topic() returns.
         """
         logger.info(f"Agent {self.agent_id} started listening on topics: {self.subscribed_topics}")
-        # در عمل، این ممکن است یک حلقه asyncio یا یک ترد باشد که منتظر پیام است
-        # self.message_bus.subscribe_multiple(topics=self.subscribed_topics, handler=self._handle_message)
 
-    def _handle_message(self, message_ Dict[str, Any]):
+    def _handle_message(self, message: Dict[str, Any]):
         """
         Internal handler to process incoming messages based on their type.
         This method should be overridden by subclasses.
@@ -294,9 +720,9 @@ class BaseAgent:
             logger.warning(f"Agent {self.agent_id} received unknown message type: {msg_type}")
 
     # متدهای خالی برای override شدن توسط زیرکلاس‌ها
-    def _on_order_signal(self, message_ Dict[str, Any]): pass
-    def _on_market_data_update(self, message_ Dict[str, Any]): pass
-    def _on_risk_alert(self, message_ Dict[str, Any]): pass
+    def _on_order_signal(self, message: Dict[str, Any]): pass
+    def _on_market_data_update(self, message: Dict[str, Any]): pass
+    def _on_risk_alert(self, message: Dict[str, Any]): pass
     # ... سایر متد هندلرها ...
 
 # --- ابزارهای کمکی ---
@@ -304,21 +730,4 @@ def create_correlation_id() -> str:
     """
     Creates a unique correlation ID for tracking related messages/requests.
     """
-    import uuid
     return str(uuid.uuid4())
-
-# --- نمونه استفاده ---
-# message_bus = MessageBus(broker_type='redis')
-# agent1 = BaseAgent({'id': 'data_collector_1'}, message_bus)
-# agent2 = BaseAgent({'id': 'trading_bot_1'}, message_bus)
-#
-# def handle_order_signal(msg):
-#     print(f"Trading Bot received signal: {msg}")
-#
-# agent2.subscribe_to_topic('signals.trading', handle_order_signal)
-# agent1.send_message('signals.trading', {'type': 'ORDER_SIGNAL', 'symbol': 'BTCUSDT', 'side': 'BUY', 'price': 50000})
-#
-# # شروع گوش دادن (در یک ترد یا asyncio)
-# # agent2.start_listening() # این ممکن است نیاز به asyncio یا threading داشته باشد
-
-logger.info("Messaging system components loaded.")
@@ -0,0 +1,126 @@
+# apps/core/metrics.py
+
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# تعداد نمونه‌های نگهداری شده برای محاسبه صدک‌ها (پنجره لغزان)
+DEFAULT_RESERVOIR_SIZE = 2048
+
+
+class MetricsRegistry:
+    """
+    Lightweight in-process registry for counters, gauges and timing/size distributions.
+    Used by hot paths (ingestion, connectors, messaging) that cannot afford a DB write per sample.
+    """
+
+    def __init__(self, reservoir_size: int = DEFAULT_RESERVOIR_SIZE):
+        self._lock = threading.Lock()
+        self._reservoir_size = reservoir_size
+        self._counters: Dict[str, float] = defaultdict(float)
+        self._gauges: Dict[str, float] = {}
+        self._observations: Dict[str, deque] = {}
+        self._observation_totals: Dict[str, list] = {}  # [count, sum, max]
+
+    def incr(self, name: str, value: float = 1) -> None:
+        """
+        Increments a monotonically increasing counter.
+        """
+        with self._lock:
+            self._counters[name] += value
+
+    def gauge(self, name: str, value: float) -> None:
+        """
+        Sets the current value of a gauge (e.g. queue depth).
+        """
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name: str, value: float) -> None:
+        """
+        Records a single sample of a distribution (e.g. latency in ms or batch size).
+        """
+        with self._lock:
+            samples = self._observations.get(name)
+            if samples is None:
+                samples = deque(maxlen=self._reservoir_size)
+                self._observations[name] = samples
+                self._observation_totals[name] = [0, 0.0, float('-inf')]
+            samples.append(value)
+            totals = self._observation_totals[name]
+            totals[0] += 1
+            totals[1] += value
+            if value > totals[2]:
+                totals[2] = value
+
+    @contextmanager
+    def timer(self, name: str):
+        """
+        Context manager that records the elapsed wall time of the block in milliseconds.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, (time.perf_counter() - start) * 1000.0)
+
+    def get_counter(self, name: str) -> float:
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def get_distribution(self, name: str) -> Optional[Dict[str, float]]:
+        """
+        Returns count/avg/max plus p50/p95/p99 over the retained samples of a distribution.
+        """
+        with self._lock:
+            samples = self._observations.get(name)
+            if not samples:
+                return None
+            ordered = sorted(samples)
+            count, total, maximum = self._observation_totals[name]
+
+        def _percentile(q: float) -> float:
+            index = min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))
+            return ordered[index]
+
+        return {
+            'count': count,
+            'avg': total / count if count else 0.0,
+            'max': maximum,
+            'p50': _percentile(0.50),
+            'p95': _percentile(0.95),
+            'p99': _percentile(0.99),
+        }
+
+    def get_stats(self, prefix: str = '') -> Dict[str, Any]:
+        """
+        Returns a JSON-serializable snapshot of all metrics whose name starts with prefix.
+        Suitable for storing in AgentStatus.metrics or exposing through an API.
+        """
+        with self._lock:
+            counters = {k: v for k, v in self._counters.items() if k.startswith(prefix)}
+            gauges = {k: v for k, v in self._gauges.items() if k.startswith(prefix)}
+            names = [k for k in self._observations if k.startswith(prefix)]
+        return {
+            'counters': counters,
+            'gauges': gauges,
+            'distributions': {name: self.get_distribution(name) for name in names},
+        }
+
+    def reset(self, prefix: str = '') -> None:
+        """
+        Clears all metrics whose name starts with prefix (all metrics by default).
+        """
+        with self._lock:
+            for store in (self._counters, self._gauges, self._observations, self._observation_totals):
+                for key in [k for k in store if k.startswith(prefix)]:
+                    del store[key]
+
+
+# رجیستری سراسری در سطح پروسس
+metrics = MetricsRegistry()
@@ -1,9 +1,12 @@
 # apps/exchanges/exceptions.py
 
+import logging
 from rest_framework.exceptions import APIException
 from django.utils.translation import gettext_lazy as _
 from apps.core.exceptions import CoreSystemException # ایمپورت از core
 
+logger = logging.getLogger(__name__)
+
 # --- خطاهای عمومی و سطح بالا (ارتقا یافته: ارث از Core) ---
 class ExchangeBaseError(CoreSystemException): # اصلاح: ارث از CoreSystemException
     """
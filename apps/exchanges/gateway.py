@@ -0,0 +1,685 @@
+# apps/exchanges/gateway.py
+
+"""
+Low-latency execution gateway for live orders.
+
+A long-running process (manage.py run_execution_gateway) keeps one warm, pre-authenticated
+connector session per ExchangeAccount and accepts orders as newline-delimited JSON over a
+local Unix socket. An order is sent to the exchange first; the reply goes back to the caller
+as soon as the exchange acknowledges it, and Order / OrderLog / OrderHistory / AuditLog rows
+are written afterwards by the batched ingest pipeline (apps.agents.ingest) on writer threads.
+
+Latency is observed in apps.core.metrics (p50/p95/p99 via get_distribution):
+    exchanges.gateway.tick_to_sent_ms      market tick (request 'tick_ts') -> order handed to the connector
+    exchanges.gateway.received_to_sent_ms  request received by the gateway -> order handed to the connector
+    exchanges.gateway.exchange_ack_ms      order handed to the connector -> exchange acknowledgement
+
+Request:  {"request_id", "account_id", "bot_id", "client_order_id", "tick_ts" (epoch ms),
+           "order": {"symbol", "side", "type", "amount", "price", ...}}
+Response: {"request_id", "status": "sent"|"rejected", "client_order_id", "exchange_order_id",
+           "response" | "error", "latency_ms": {...}}
+"""
+
+import asyncio
+import inspect
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from typing import Any, Callable, Dict, List, Optional
+
+from django.conf import settings
+
+from apps.core.metrics import metrics
+from .exceptions import ExchangeConnectionError, OrderExecutionError, UnsupportedExchangeFeatureError
+
+logger = logging.getLogger(__name__)
+
+METRIC_PREFIX = 'exchanges.gateway'
+
+KIND_ORDER = 'order'
+
+REQUIRED_ORDER_PARAMS = ('symbol', 'side', 'type', 'amount')
+
+# تنظیمات پیش‌فرض؛ settings.EXECUTION_GATEWAY آن‌ها را بازنویسی می‌کند
+DEFAULT_EXECUTION_GATEWAY = {
+    'socket_path': None,                # پیش‌فرض: settings.EXECUTION_GATEWAY_SOCKET
+    'send_workers': 8,                  # نخ‌های ارسال برای کانکتورهای sync (هر حساب یک نخ در لحظه)
+    'session_check_seconds': 30,        # فاصله بررسی اتصال نشست‌ها و اتصال مجدد
+    'warm_accounts': True,              # باز کردن نشست تمام حساب‌های فعال واقعی هنگام شروع
+    'client_timeout_seconds': 10.0,
+    'ingest': {'writers': 1, 'max_batch_size': 200, 'max_latency_ms': 50},
+    'record_attempts': 3,               # تلاش‌های نوشتن هر سفارش در دیتابیس پیش از spill روی دیسک
+    'failed_records_dir': None,         # پیش‌فرض: <AGENT_INGEST_SPILL_DIR>/execution_gateway_failed
+    'max_failed_records_bytes': 64 * 1024 * 1024,
+}
+
+
+def get_execution_gateway_settings() -> Dict[str, Any]:
+    merged = dict(DEFAULT_EXECUTION_GATEWAY)
+    overrides = getattr(settings, 'EXECUTION_GATEWAY', None) or {}
+    if isinstance(overrides, dict):
+        merged.update(overrides)
+    if not merged['socket_path']:
+        merged['socket_path'] = getattr(settings, 'EXECUTION_GATEWAY_SOCKET', '/tmp/execution_gateway.sock')
+    return merged
+
+
+def _now_ms() -> float:
+    return time.time() * 1000
+
+
+# --- نشست‌های گرم هر حساب ---
+
+def default_account_loader(account_id):
+    from .models import ExchangeAccount # Import داخل تابع برای جلوگیری از حلقه
+    return ExchangeAccount.objects.select_related('exchange', 'owner').get(id=account_id, is_active=True)
+
+
+def default_connector_factory(account):
+    """
+    Trading connector (apps.connectors.base.ExchangeConnector) of an account, built with its decrypted keys.
+    """
+    from apps.connectors.base import ExchangeConnector # Import داخل تابع برای جلوگیری از حلقه
+    from apps.connectors.registry import get_connector
+
+    connector_class = get_connector(account.exchange.code)
+    if connector_class is None or not issubclass(connector_class, ExchangeConnector):
+        raise UnsupportedExchangeFeatureError(f"No trading connector registered for {account.exchange.code}.")
+    return connector_class(api_key=account.api_key, api_secret=account.api_secret, exchange_account_id=account.id,
+                           exchange_account=account)
+
+
+class OrderSession:
+    """
+    One pre-authenticated connector of an ExchangeAccount; orders of an account are sent one at a time.
+    """
+
+    def __init__(self, account, connector):
+        self.account_id = str(account.id)
+        self.owner_id = account.owner_id
+        self.exchange_id = account.exchange_id
+        self.exchange_code = account.exchange.code
+        self.connector = connector
+        self.lock = asyncio.Lock()
+        self.opened_at = None
+
+    def open(self):
+        connect = getattr(self.connector, 'connect', None)
+        if connect is not None and connect() is False:
+            raise ExchangeConnectionError(f"Could not connect account {self.account_id} to {self.exchange_code}.")
+        self.opened_at = time.time()
+
+    def is_connected(self) -> bool:
+        is_connected = getattr(self.connector, 'is_connected', None)
+        return bool(is_connected()) if is_connected is not None else True
+
+    def close(self):
+        disconnect = getattr(self.connector, 'disconnect', None)
+        if disconnect is not None:
+            try:
+                disconnect()
+            except Exception as e:
+                logger.warning(f"Error closing order session of account {self.account_id}: {e}")
+
+
+class OrderSessionPool:
+    """
+    Warm OrderSessions keyed by account id. DB and connect() calls run on the executor, never on the loop.
+    """
+
+    def __init__(self, executor: ThreadPoolExecutor, account_loader: Callable = default_account_loader,
+                 connector_factory: Callable = default_connector_factory):
+        self._executor = executor
+        self._account_loader = account_loader
+        self._connector_factory = connector_factory
+        self._sessions: Dict[str, OrderSession] = {}
+        self._opening: Dict[str, asyncio.Future] = {}
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _open(self, account_id) -> OrderSession:
+        from django.db import close_old_connections # Import داخل تابع؛ فقط در نخ‌های اجرایی
+
+        close_old_connections()
+        try:
+            account = self._account_loader(account_id)
+            session = OrderSession(account, self._connector_factory(account))
+            session.open()
+            return session
+        finally:
+            close_old_connections()
+
+    async def get(self, account_id) -> OrderSession:
+        key = str(account_id)
+        session = self._sessions.get(key)
+        if session is not None:
+            return session
+        # درخواست‌های همزمان یک حساب منتظر همان باز شدن نشست می‌مانند
+        pending = self._opening.get(key)
+        if pending is None:
+            pending = asyncio.get_running_loop().run_in_executor(self._executor, self._open, account_id)
+            self._opening[key] = pending
+            try:
+                self._sessions[key] = await pending
+                metrics.gauge(f'{METRIC_PREFIX}.sessions', len(self._sessions))
+            finally:
+                self._opening.pop(key, None)
+            return self._sessions[key]
+        return await asyncio.shield(pending)
+
+    async def warm(self, account_ids: List) -> int:
+        results = await asyncio.gather(*(self.get(account_id) for account_id in account_ids), return_exceptions=True)
+        for account_id, result in zip(account_ids, results):
+            if isinstance(result, Exception):
+                logger.error(f"Could not open order session for account {account_id}: {result}")
+        return sum(1 for result in results if not isinstance(result, Exception))
+
+    async def check(self):
+        """
+        Reconnects sessions whose connector reports it is no longer connected.
+        """
+        loop = asyncio.get_running_loop()
+        for key, session in list(self._sessions.items()):
+            if session.lock.locked():
+                continue
+            connected = await loop.run_in_executor(self._executor, session.is_connected)
+            if not connected:
+                metrics.incr(f'{METRIC_PREFIX}.reconnects')
+                self._sessions.pop(key, None)
+                await loop.run_in_executor(self._executor, session.close)
+                try:
+                    await self.get(key)
+                except Exception as e:
+                    logger.error(f"Reconnect of order session for account {key} failed: {e}")
+
+    def drop(self, account_id):
+        session = self._sessions.pop(str(account_id), None)
+        if session is not None:
+            session.close()
+
+    def close(self):
+        for session in self._sessions.values():
+            session.close()
+        self._sessions.clear()
+
+
+# --- ثبت سفارش‌ها در دیتابیس (در نخ‌های نویسنده، پس از ارسال) ---
+
+def _decimal(value) -> Optional[Decimal]:
+    if value in (None, ''):
+        return None
+    return value if isinstance(value, Decimal) else Decimal(str(value))
+
+
+def order_record(session: OrderSession, request: Dict, status: str, response: Optional[Dict],
+                 error: Optional[str], latency: Dict[str, float]) -> Dict[str, Any]:
+    """
+    JSON-safe description of a sent (or rejected) order for the ingest queue.
+    """
+    order = request['order']
+    return {
+        'account_id': session.account_id,
+        'owner_id': session.owner_id,
+        'exchange_id': session.exchange_id,
+        'bot_id': request.get('bot_id'),
+        'agent_id': request.get('agent_id'),
+        'client_order_id': request['client_order_id'],
+        'exchange_order_id': str((response or {}).get('order_id') or (response or {}).get('orderId') or ''),
+        'symbol': order['symbol'],
+        'side': str(order['side']).upper(),
+        'order_type': str(order['type']).upper(),
+        'quantity': str(order['amount']),
+        'price': str(order['price']) if order.get('price') not in (None, '') else None,
+        'time_in_force': order.get('time_in_force') or 'GTC',
+        'status': status,
+        'response': response or {},
+        'error': error,
+        'sent_at_ms': latency.get('sent_at_ms'),
+        'latency_ms': {name: value for name, value in latency.items() if name != 'sent_at_ms'},
+    }
+
+
+def _write_order_record(record: Dict[str, Any], instruments: Dict) -> None:
+    """
+    Writes one gateway order (Order + OrderLog, OrderHistory, AuditLog) in its own transaction.
+    """
+    from django.db import transaction
+    from apps.core.models import AuditLog # Import داخل تابع برای جلوگیری از حلقه
+    from apps.instruments.models import InstrumentExchangeMap
+    from apps.market_data.storage import from_epoch_ms
+    from apps.trading.models import Order, OrderLog
+    from .models import OrderHistory
+
+    # نگاشت نماد صرافی -> Instrument یک بار برای کل batch
+    key = (record['exchange_id'], record['symbol'])
+    if key not in instruments:
+        instruments[key] = (
+            InstrumentExchangeMap.objects
+            .filter(exchange_id=record['exchange_id'], exchange_symbol=record['symbol'])
+            .values_list('instrument_id', flat=True)
+            .first()
+        )
+
+    placed_at = from_epoch_ms(record['sent_at_ms'] or _now_ms())
+    details = {'latency_ms': record['latency_ms'], 'response': record['response'], 'error': record['error']}
+    with transaction.atomic():
+        order = None
+        instrument_id = instruments[key]
+        if instrument_id is not None:
+            order, created = Order.objects.get_or_create(
+                client_order_id=record['client_order_id'],
+                defaults={
+                    'user_id': record['owner_id'],
+                    'exchange_account_id': record['account_id'],
+                    'instrument_id': instrument_id,
+                    'bot_id': record['bot_id'],
+                    'agent_id': record['agent_id'],
+                    'side': record['side'],
+                    'order_type': record['order_type'],
+                    'quantity': _decimal(record['quantity']),
+                    'price': _decimal(record['price']),
+                    'time_in_force': record['time_in_force'],
+                    'status': record['status'],
+                    'exchange_order_id': record['exchange_order_id'],
+                },
+            )
+            OrderLog.objects.create(
+                order=order,
+                old_status='' if created else order.status,
+                new_status=record['status'],
+                message=record['error'] or 'Sent by execution gateway',
+                details=details,
+            )
+        else:
+            logger.warning(f"No instrument mapped for {record['symbol']} on exchange {record['exchange_id']}; Order row skipped.")
+
+        if record['exchange_order_id']:
+            OrderHistory.objects.create(
+                exchange_account_id=record['account_id'],
+                order_id=record['exchange_order_id'],
+                symbol=record['symbol'],
+                side=record['side'],
+                order_type=record['order_type'],
+                status=record['status'],
+                price=_decimal(record['price']) or Decimal('0'),
+                quantity=_decimal(record['quantity']),
+                time_placed=placed_at,
+                time_updated=placed_at,
+                trading_bot_id=record['bot_id'],
+            )
+
+        AuditLog.objects.create(
+            user_id=record['owner_id'],
+            action='ORDER_PLACED' if record['status'] != 'REJECTED' else 'ORDER_PLACEMENT_ERROR',
+            target_model='Order',
+            target_id=order.id if order is not None else None,
+            details={
+                'account_id': record['account_id'],
+                'client_order_id': record['client_order_id'],
+                'exchange_order_id': record['exchange_order_id'],
+                'order_params': {key: record[key] for key in ('symbol', 'side', 'order_type', 'quantity', 'price')},
+                'error': record['error'],
+                'latency_ms': record['latency_ms'],
+            },
+        )
+
+
+# سفارش‌های ارسال‌شده‌ای که ثبتشان ناموفق بود روی دیسک می‌مانند تا دوباره نوشته شوند
+_failed_records = None
+
+
+def get_failed_order_records():
+    """
+    SpillStore (apps.agents.ingest) of order records whose database write failed.
+    """
+    global _failed_records
+    if _failed_records is None:
+        from apps.agents.ingest import SpillStore, get_agent_ingest_settings # Import داخل تابع برای جلوگیری از حلقه
+
+        options = get_execution_gateway_settings()
+        directory = options['failed_records_dir'] or os.path.join(
+            get_agent_ingest_settings()['spill_dir'], 'execution_gateway_failed'
+        )
+        _failed_records = SpillStore(directory, int(options['max_failed_records_bytes']))
+    return _failed_records
+
+
+def write_order_records(records: List[Dict[str, Any]], failed_store=None) -> int:
+    """
+    Persists gateway orders one transaction per record. A record that still fails after
+    `record_attempts` tries is spilled to disk instead of aborting the rest of the batch.
+    """
+    from django.db import close_old_connections # Import داخل تابع؛ فقط در نخ‌های نویسنده
+
+    attempts = max(1, int(get_execution_gateway_settings()['record_attempts']))
+    instruments = {}
+    written, failed = 0, []
+    for record in records:
+        for attempt in range(attempts):
+            try:
+                _write_order_record(record, instruments)
+                written += 1
+                break
+            except Exception as e:
+                # اتصال خراب پیش از تلاش بعدی بسته و دوباره باز می‌شود
+                close_old_connections()
+                if attempt + 1 == attempts:
+                    logger.error(f"Recording order {record['client_order_id']} failed after {attempts} attempts: {e}")
+                    failed.append(record)
+    if failed:
+        metrics.incr(f'{METRIC_PREFIX}.record_failures', len(failed))
+        store = failed_store if failed_store is not None else get_failed_order_records()
+        if not store.write([(KIND_ORDER, record) for record in failed]):
+            metrics.incr(f'{METRIC_PREFIX}.records_lost', len(failed))
+            logger.critical(
+                f"Spill of failed order records is full; {len(failed)} sent orders were not recorded: "
+                f"{', '.join(record['client_order_id'] for record in failed)}"
+            )
+    return written
+
+
+def replay_failed_order_records(writer: Callable = write_order_records, failed_store=None) -> int:
+    """
+    Writes one spilled segment of failed order records again; records failing again are re-spilled by the writer.
+    """
+    store = failed_store if failed_store is not None else get_failed_order_records()
+    records = [payload for kind, payload in store.pop() if kind == KIND_ORDER]
+    if not records:
+        return 0
+    written = writer(records)
+    metrics.incr(f'{METRIC_PREFIX}.records_replayed', written)
+    return written
+
+
+# --- گیت‌وی ---
+
+class ExecutionGateway:
+    """
+    Accepts orders on a Unix socket and sends them through warm per-account sessions.
+    """
+
+    def __init__(self, options: Optional[Dict[str, Any]] = None, account_loader: Callable = default_account_loader,
+                 connector_factory: Callable = default_connector_factory, record_writer: Callable = write_order_records,
+                 clock: Callable = _now_ms):
+        from apps.agents.ingest import AgentIngestPipeline, get_agent_ingest_settings # Import داخل تابع برای جلوگیری از حلقه
+
+        self.options = options or get_execution_gateway_settings()
+        self._clock = clock
+        self._record_writer = record_writer
+        self._executor = ThreadPoolExecutor(max_workers=self.options['send_workers'], thread_name_prefix='order-send')
+        self.sessions = OrderSessionPool(self._executor, account_loader, connector_factory)
+        self.ingest = AgentIngestPipeline(
+            'execution-gateway',
+            get_agent_ingest_settings({'ingest': self.options.get('ingest') or {}}),
+            writers={KIND_ORDER: record_writer},
+            metric_writer=lambda *args: None,
+        )
+        self._server = None
+        self._maintenance: Optional[asyncio.Task] = None
+        self._clients: Dict[asyncio.StreamReader, asyncio.Task] = {}
+        self.stats = {'received': 0, 'sent': 0, 'rejected': 0}
+
+    # --- چرخه حیات ---
+    async def start(self, warm_account_ids: Optional[List] = None, serve: bool = True):
+        await self.ingest.start()
+        if warm_account_ids:
+            opened = await self.sessions.warm(warm_account_ids)
+            logger.info(f"Execution gateway warmed {opened}/{len(warm_account_ids)} order sessions.")
+        if serve:
+            path = self.options['socket_path']
+            if os.path.exists(path):
+                os.unlink(path)
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            self._server = await asyncio.start_unix_server(self._serve_client, path=path)
+            os.chmod(path, 0o660)
+            logger.info(f"Execution gateway listening on {path}.")
+        self._maintenance = asyncio.create_task(self._maintenance_loop())
+
+    async def serve_forever(self):
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            # پایان خواندن هر کلاینت؛ سفارش‌های در حال ارسال پاسخ خود را می‌گیرند
+            for reader in list(self._clients):
+                reader.feed_eof()
+            await asyncio.gather(*self._clients.values(), return_exceptions=True)
+            await self._server.wait_closed()
+        if self._maintenance is not None:
+            self._maintenance.cancel()
+            await asyncio.gather(self._maintenance, return_exceptions=True)
+        await self.ingest.close()
+        self.sessions.close()
+        self._executor.shutdown(wait=True)
+
+    async def _maintenance_loop(self):
+        while True:
+            await asyncio.sleep(self.options['session_check_seconds'])
+            try:
+                await self.sessions.check()
+            except Exception as e:
+                logger.error(f"Order session check failed: {e}")
+            if self._record_writer is write_order_records:
+                try:
+                    await asyncio.get_running_loop().run_in_executor(self._executor, self._replay_failed_records)
+                except Exception as e:
+                    logger.error(f"Replay of failed order records failed: {e}")
+
+    def _replay_failed_records(self) -> int:
+        from django.db import close_old_connections # Import داخل تابع؛ فقط در نخ‌های اجرایی
+
+        close_old_connections()
+        try:
+            return replay_failed_order_records(self._record_writer)
+        finally:
+            close_old_connections()
+
+    # --- کانال محلی (Unix socket، یک JSON در هر خط) ---
+    async def _serve_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._clients[reader] = asyncio.current_task()
+        pending = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                task = asyncio.create_task(self._reply(line, writer))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+        except (ConnectionResetError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+            self._clients.pop(reader, None)
+            writer.close()
+
+    async def _reply(self, line: bytes, writer: asyncio.StreamWriter):
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            response = {'status': 'rejected', 'error': f"invalid request: {e}"}
+        else:
+            response = await self.handle_order(request)
+        writer.write(json.dumps(response, default=str).encode() + b'\n')
+        try:
+            await writer.drain()
+        except ConnectionResetError:
+            logger.warning(f"Execution gateway client left before reply of {response.get('client_order_id')}.")
+
+    # --- مسیر سفارش ---
+    async def handle_order(self, request: Dict) -> Dict[str, Any]:
+        received_ms = self._clock()
+        self.stats['received'] += 1
+        order = request.get('order') or {}
+        request.setdefault('client_order_id', order.get('client_order_id') or uuid.uuid4().hex)
+        reply = {'request_id': request.get('request_id'), 'client_order_id': request['client_order_id']}
+
+        missing = [param for param in REQUIRED_ORDER_PARAMS if param not in order]
+        if missing or request.get('account_id') is None:
+            return self._rejected(reply, f"Missing required order parameter: {', '.join(missing) or 'account_id'}")
+        try:
+            session = await self.sessions.get(request['account_id'])
+        except Exception as e:
+            logger.error(f"No order session for account {request['account_id']}: {e}")
+            return self._rejected(reply, f"No order session: {e}")
+
+        async with session.lock:
+            sent_ms = self._clock()
+            try:
+                response = await self._send(session, order, request['client_order_id'])
+                error, status = None, str((response or {}).get('status') or 'NEW').upper()
+            except Exception as e:
+                response, error, status = None, str(e), 'REJECTED'
+            acked_ms = self._clock()
+
+        latency = {
+            'sent_at_ms': sent_ms,
+            'received_to_sent': sent_ms - received_ms,
+            'exchange_ack': acked_ms - sent_ms,
+        }
+        metrics.observe(f'{METRIC_PREFIX}.received_to_sent_ms', latency['received_to_sent'])
+        metrics.observe(f'{METRIC_PREFIX}.exchange_ack_ms', latency['exchange_ack'])
+        if request.get('tick_ts'):
+            latency['tick_to_sent'] = sent_ms - float(request['tick_ts'])
+            metrics.observe(f'{METRIC_PREFIX}.tick_to_sent_ms', latency['tick_to_sent'])
+
+        # ثبت در دیتابیس بعد از ارسال و بدون انتظار برای نویسنده‌ها
+        if not self.ingest.offer(KIND_ORDER, order_record(session, request, status, response, error, latency)):
+            metrics.incr(f'{METRIC_PREFIX}.unrecorded')
+            logger.error(f"Order {request['client_order_id']} was sent but could not be queued for recording.")
+
+        reply['latency_ms'] = {name: round(value, 3) for name, value in latency.items() if name != 'sent_at_ms'}
+        if error is not None:
+            return self._rejected(reply, error)
+        self.stats['sent'] += 1
+        metrics.incr(f'{METRIC_PREFIX}.sent')
+        reply.update(status='sent', exchange_order_id=str((response or {}).get('order_id') or (response or {}).get('orderId') or ''),
+                     response=response)
+        return reply
+
+    async def _send(self, session: OrderSession, order: Dict, client_order_id: str):
+        extra = {key: value for key, value in order.items() if key not in REQUIRED_ORDER_PARAMS and key != 'price'}
+        extra['client_order_id'] = client_order_id
+        call = lambda: session.connector.place_order(  # noqa: E731
+            symbol=order['symbol'],
+            side=str(order['side']).upper(),
+            order_type=str(order['type']).upper(),
+            quantity=_decimal(order['amount']),
+            price=_decimal(order.get('price')),
+            **extra,
+        )
+        if inspect.iscoroutinefunction(session.connector.place_order):
+            return await call()
+        return await asyncio.get_running_loop().run_in_executor(self._executor, call)
+
+    def _rejected(self, reply: Dict, error: str) -> Dict[str, Any]:
+        self.stats['rejected'] += 1
+        metrics.incr(f'{METRIC_PREFIX}.rejected')
+        reply.update(status='rejected', error=error)
+        return reply
+
+    def get_stats(self) -> Dict[str, Any]:
+        latency = {
+            name: metrics.get_distribution(f'{METRIC_PREFIX}.{name}_ms')
+            for name in ('tick_to_sent', 'received_to_sent', 'exchange_ack')
+        }
+        return dict(self.stats, sessions=len(self.sessions), ingest=self.ingest.get_stats(), latency_ms=latency)
+
+
+# --- کلاینت (در پروسس‌های عامل/بات) ---
+
+class GatewayUnavailable(ExchangeConnectionError):
+    default_detail = 'Execution gateway is not reachable.'
+    default_code = 'execution_gateway_unavailable'
+
+
+class ExecutionGatewayClient:
+    """
+    Blocking client with one persistent Unix socket per thread.
+    """
+
+    def __init__(self, socket_path: Optional[str] = None, timeout: Optional[float] = None):
+        options = get_execution_gateway_settings()
+        self.socket_path = socket_path or options['socket_path']
+        self.timeout = timeout or options['client_timeout_seconds']
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.socket_path)
+            except OSError as e:
+                sock.close()
+                raise GatewayUnavailable(f"Execution gateway at {self.socket_path} is not reachable: {e}")
+            connection = self._local.connection = (sock, sock.makefile('rb'))
+        return connection
+
+    def _reset(self):
+        connection = getattr(self._local, 'connection', None)
+        self._local.connection = None
+        if connection is not None:
+            connection[1].close()
+            connection[0].close()
+
+    def place_order(self, account_id, order_params: Dict, bot_id=None, tick_ts: Optional[float] = None,
+                    client_order_id: Optional[str] = None, **extra) -> Dict[str, Any]:
+        request = dict(extra, account_id=str(account_id), bot_id=str(bot_id) if bot_id is not None else None,
+                       order=order_params, tick_ts=tick_ts,
+                       client_order_id=client_order_id or order_params.get('client_order_id') or uuid.uuid4().hex)
+        request['request_id'] = request['client_order_id']
+        sock, stream = self._connection()
+        try:
+            sock.sendall(json.dumps(request, default=str).encode() + b'\n')
+        except OSError as e:
+            # هنوز چیزی ارسال نشده؛ فراخواننده می‌تواند از مسیر Celery استفاده کند
+            self._reset()
+            raise GatewayUnavailable(f"Could not send order to the execution gateway: {e}")
+        try:
+            line = stream.readline()
+        except OSError as e:
+            self._reset()
+            raise OrderExecutionError(f"No reply from the execution gateway for {request['client_order_id']}: {e}")
+        if not line:
+            self._reset()
+            raise OrderExecutionError(f"Execution gateway closed the connection before replying to {request['client_order_id']}.")
+        return json.loads(line)
+
+
+# نمونه سراسری کلاینت برای پروسس‌های فراخواننده (اتصال‌ها در هر نخ باز می‌مانند)
+_client: Optional[ExecutionGatewayClient] = None
+
+
+def get_execution_gateway_client() -> ExecutionGatewayClient:
+    global _client
+    if _client is None:
+        _client = ExecutionGatewayClient()
+    return _client
+
+
+def submit_live_order(account_id, bot_id, order_params: Dict, tick_ts: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Sends a live order through the execution gateway; falls back to place_order_task (Celery)
+    only when the gateway is unreachable before the order was written to it.
+    """
+    try:
+        return get_execution_gateway_client().place_order(account_id, order_params, bot_id=bot_id, tick_ts=tick_ts)
+    except GatewayUnavailable as e:
+        from .tasks import place_order_task # Import داخل تابع برای جلوگیری از حلقه
+
+        logger.warning(f"{e} Falling back to place_order_task.")
+        metrics.incr(f'{METRIC_PREFIX}.celery_fallbacks')
+        result = place_order_task.delay(account_id, bot_id, order_params)
+        return {'status': 'queued', 'task_id': result.id}
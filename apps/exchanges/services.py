@@ -18,6 +18,7 @@ from .models import (
 from apps.bots.models import TradingBot # import از اپلیکیشن دیگر
 from apps.connectors.service import ConnectorService # import از اپلیکیشن دیگر
 from apps.market_data.service import MarketDataService # import از اپلیکیشن دیگر
+from apps.market_data.hot_cache import hot_market_cache
 from apps.core.models import AuditLog # import از اپلیکیشن core
 from apps.core.exceptions import (
     CoreSystemException,
@@ -510,12 +511,21 @@ class ExchangeMarketDataService:
     """
     def __init__(self):
         self.market_data_service = MarketDataService() # از سرویس مرکزی استفاده می‌کند
+        self.connector_service = ConnectorService()
 
     def get_latest_price(self, account: ExchangeAccount, symbol: str) -> Decimal:
         """
         Retrieves the latest price for a symbol from the specific exchange account's source.
         """
-        # ممکن است نیاز به دسترسی مستقیم به کانکتور باشد
+        # 1. کش داغ بازار (بدون مراجعه به پایگاه داده یا API صرافی)
+        cached = hot_market_cache.get_latest_price(
+            symbol, source=account.exchange.code,
+            max_age_ms=getattr(settings, 'MARKET_DATA_HOT_CACHE_PRICE_MAX_AGE_MS', 5000),
+        )
+        if cached is not None:
+            return Decimal(str(cached[0]))
+
+        # 2. دسترسی مستقیم به کانکتور
         try:
             raw_ticker = self.connector_service.get_ticker(account, symbol)
             normalized_data = normalize_data_from_source(raw_ticker, account.exchange.name, 'TICKER')
@@ -578,7 +588,7 @@ class ExchangeAgentService:
                 'data': order_data,
                 'timestamp': timezone.now().isoformat()
             }
-            message_bus.publish(f'agent.{agent_id}', message)
+            message_bus.publish_sync(f'agent.{agent_id}', message, message_type='ORDER_UPDATE')
             logger.info(f"Order update notification sent to agent {agent_id}.")
         except Exception as e:
             logger.error(f"Failed to notify agent {agent_id} of order update: {str(e)}")
@@ -601,7 +611,7 @@ class ExchangeAgentService:
                 'timestamp': timezone.now().isoformat()
             }
             # ارسال به یک چنل عمومی یا چنل‌های مرتبط با نماد
-            message_bus.broadcast(message, exclude_senders=[]) # ممکن است نیاز به فیلتر کردن داشته باشد
+            message_bus.publish_sync('broadcast', message, message_type='MARKET_DATA_UPDATE') # ممکن است نیاز به فیلتر کردن داشته باشد
             logger.debug(f"Market data broadcast sent for {symbol} on {exchange_name}.")
         except Exception as e:
             logger.error(f"Failed to broadcast market data for {symbol} on {exchange_name}: {str(e)}")
@@ -154,6 +154,16 @@ class MarketDataConsumer(AsyncWebsocketConsumer):
             # ممکن است بخواهید اتصال را ببندید یا فقط خطا را گزارش دهید
 
 
+    async def order_book_update(self, event):
+        """
+        Binary order book fan-out (order_book_codec); forwarded to the client as a binary frame.
+        """
+        try:
+            await self.send(bytes_data=event['payload'])
+        except Exception as e:
+            logger.error(f"Error sending order book to WebSocket for user {self.user.username}: {str(e)}")
+
+
     @database_sync_to_async
     def _validate_subscription(self, symbol: str, exchange_name: str, data_type: str) -> bool:
         """
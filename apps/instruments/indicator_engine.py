@@ -0,0 +1,747 @@
+# apps/instruments/indicator_engine.py
+
+import json
+import logging
+import math
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+from .exceptions import IndicatorValidationError
+
+logger = logging.getLogger(__name__)
+
+# --- رجیستری محاسبه‌گرها (مشابه register_connector در apps/connectors/registry.py) ---
+_INDICATOR_CALCULATORS: Dict[str, type] = {}
+
+
+def register_indicator(*codes: str):
+    """
+    Decorator that registers a streaming indicator class under one or more Indicator.code values.
+    """
+    def decorator(cls):
+        for code in codes:
+            _INDICATOR_CALCULATORS[code.upper()] = cls
+        return cls
+    return decorator
+
+
+def get_indicator_class(code: str) -> type:
+    try:
+        return _INDICATOR_CALCULATORS[code.upper()]
+    except KeyError:
+        raise IndicatorValidationError(f"No streaming implementation registered for indicator code '{code}'.")
+
+
+def _coerce_parameter(data_type: str, value: Any) -> Any:
+    if data_type == 'int':
+        return int(value)
+    if data_type == 'float':
+        return float(value)
+    if data_type == 'bool':
+        return value.lower() in ['true', '1', 'yes', 'on'] if isinstance(value, str) else bool(value)
+    return value
+
+
+def resolve_template_parameters(template) -> Dict[str, Any]:
+    """
+    Merges IndicatorParameter defaults with IndicatorTemplate.parameters and coerces types.
+    """
+    resolved = {}
+    definitions = {param.name: param for param in template.indicator.parameters.all()}
+    for name, param in definitions.items():
+        if param.default_value not in (None, ''):
+            resolved[name] = _coerce_parameter(param.data_type, param.default_value)
+    for name, value in (template.parameters or {}).items():
+        param = definitions.get(name)
+        resolved[name] = _coerce_parameter(param.data_type, value) if param else value
+    return resolved
+
+
+def _seeded_ema(values: np.ndarray, period: int, alpha: float) -> np.ndarray:
+    """
+    Vectorized recursive average seeded with the SMA of the first `period` values
+    (standard EMA when alpha=2/(period+1), Wilder smoothing when alpha=1/period).
+    """
+    out = np.full(len(values), np.nan)
+    if len(values) < period:
+        return out
+    seeded = np.array(values[period - 1:], dtype=np.float64)
+    seeded[0] = np.mean(values[:period])
+    out[period - 1:] = pd.Series(seeded).ewm(alpha=alpha, adjust=False).mean().to_numpy()
+    return out
+
+
+class StreamingIndicator:
+    """
+    Base class for O(1)-per-bar indicators. Subclasses implement update(), warm_up()
+    and the state (de)serialization used for snapshots.
+    """
+    code = None
+    # اندیکاتورهای بازگشتی (EMA/RSI/ATR) حافظه نامحدود دارند؛ این تعداد دوره برای همگرایی گرم‌کردن کافی است
+    WARMUP_PERIODS = 10
+
+    def __init__(self, **params):
+        self.params = params
+        self.last_ts: Optional[int] = None
+        self.value: Optional[Dict[str, float]] = None
+        # وضعیت پیش از آخرین کندل؛ برای جایگزینی به‌روزرسانی‌های کندل باز (همان timestamp)
+        self._undo: Optional[Dict[str, Any]] = None
+
+    @property
+    def period(self) -> int:
+        period = int(self.params.get('period', 14))
+        if period < 1:
+            raise IndicatorValidationError(f"Parameter 'period' must be >= 1 for {self.code}.")
+        return period
+
+    @property
+    def warmup_bars(self) -> int:
+        """
+        Bars of history a warm-up needs for the streaming value to match a full-history warm-up.
+        """
+        periods = int(getattr(settings, 'INDICATOR_WARMUP_PERIODS', self.WARMUP_PERIODS))
+        return self.period * periods + 1
+
+    def _source(self, bar: Dict[str, float]) -> float:
+        return float(bar[self.params.get('source', 'close')])
+
+    def _source_array(self, arrays) -> np.ndarray:
+        name = self.params.get('source', 'close')
+        return np.asarray(getattr(arrays, f"{name}_price" if name in ('open', 'high', 'low', 'close') else name), dtype=np.float64)
+
+    def on_bar(self, bar: Dict[str, float]) -> Optional[Dict[str, float]]:
+        """
+        Feeds one bar ({'timestamp' (ms), 'open', 'high', 'low', 'close', 'volume'}).
+        A bar with the last processed timestamp is an intra-bar update and replaces that bar
+        (the state is rolled back one step); bars before it are ignored.
+        """
+        ts = int(bar['timestamp'])
+        if self.last_ts is not None and ts <= self.last_ts:
+            if ts < self.last_ts or self._undo is None:
+                return self.value
+            self._rollback(self._undo)
+        self._undo = self._checkpoint()
+        self.last_ts = ts
+        self.value = self.update(bar)
+        return self.value
+
+    def update(self, bar: Dict[str, float]) -> Optional[Dict[str, float]]:
+        raise NotImplementedError
+
+    def _checkpoint(self) -> Dict[str, Any]:
+        """
+        State needed to undo the next update(); scalar states simply reuse _dump().
+        """
+        return self._dump()
+
+    def _rollback(self, checkpoint: Dict[str, Any]):
+        self._load(checkpoint)
+
+    def warm_up(self, arrays) -> Dict[str, np.ndarray]:
+        """
+        Computes the full output series over historical arrays (vectorized) and
+        leaves the streaming state positioned after the last bar.
+        """
+        raise NotImplementedError
+
+    def _finish_warm_up(self, arrays, series: Dict[str, np.ndarray]):
+        self._undo = None
+        if len(arrays):
+            self.last_ts = int(arrays.timestamp[-1])
+            last = {name: float(values[-1]) for name, values in series.items()}
+            self.value = None if any(math.isnan(v) for v in last.values()) else last
+        return series
+
+    def get_state(self) -> Dict[str, Any]:
+        return {'code': self.code, 'params': self.params, 'last_ts': self.last_ts, 'value': self.value,
+                'state': self._dump(), 'undo': self._undo}
+
+    @classmethod
+    def from_state(cls, data: Dict[str, Any]) -> 'StreamingIndicator':
+        indicator = get_indicator_class(data['code'])(**data['params'])
+        indicator.last_ts = data['last_ts']
+        indicator.value = data['value']
+        indicator._load(data['state'])
+        indicator._undo = data.get('undo')
+        return indicator
+
+    def _dump(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def _load(self, state: Dict[str, Any]):
+        raise NotImplementedError
+
+
+@register_indicator('SMA', 'MA')
+class SMAIndicator(StreamingIndicator):
+    """
+    Simple moving average with a rolling sum.
+    """
+    code = 'SMA'
+
+    def __init__(self, **params):
+        super().__init__(**params)
+        self._window = deque(maxlen=self.period)
+        self._sum = 0.0
+
+    @property
+    def warmup_bars(self) -> int:
+        return self.period
+
+    def update(self, bar):
+        x = self._source(bar)
+        if len(self._window) == self.period:
+            self._sum -= self._window[0]
+        self._window.append(x)
+        self._sum += x
+        return {'value': self._sum / self.period} if len(self._window) == self.period else None
+
+    def warm_up(self, arrays):
+        values = self._source_array(arrays)
+        series = pd.Series(values).rolling(self.period).mean().to_numpy()
+        tail = values[-self.period:]
+        self._window = deque(tail.tolist(), maxlen=self.period)
+        self._sum = float(tail.sum())
+        return self._finish_warm_up(arrays, {'value': series})
+
+    def _checkpoint(self):
+        evicted = self._window[0] if len(self._window) == self.period else None
+        return {'evicted': evicted, 'sum': self._sum}
+
+    def _rollback(self, checkpoint):
+        self._window.pop()
+        if checkpoint['evicted'] is not None:
+            self._window.appendleft(checkpoint['evicted'])
+        self._sum = checkpoint['sum']
+
+    def _dump(self):
+        return {'window': list(self._window)}
+
+    def _load(self, state):
+        self._window = deque(state['window'], maxlen=self.period)
+        self._sum = float(sum(self._window))
+
+
+@register_indicator('EMA')
+class EMAIndicator(StreamingIndicator):
+    """
+    Exponential moving average (recursive, seeded with the SMA of the first period).
+    """
+    code = 'EMA'
+
+    def __init__(self, **params):
+        super().__init__(**params)
+        self._alpha = 2.0 / (self.period + 1)
+        self._count = 0
+        self._seed_sum = 0.0
+        self._ema: Optional[float] = None
+
+    def update(self, bar):
+        x = self._source(bar)
+        self._count += 1
+        if self._ema is None:
+            self._seed_sum += x
+            if self._count < self.period:
+                return None
+            self._ema = self._seed_sum / self.period
+        else:
+            self._ema += self._alpha * (x - self._ema)
+        return {'value': self._ema}
+
+    def warm_up(self, arrays):
+        values = self._source_array(arrays)
+        series = _seeded_ema(values, self.period, self._alpha)
+        self._count = len(values)
+        if len(values) >= self.period:
+            self._ema = float(series[-1])
+        else:
+            self._seed_sum = float(values.sum())
+        return self._finish_warm_up(arrays, {'value': series})
+
+    def _dump(self):
+        return {'count': self._count, 'seed_sum': self._seed_sum, 'ema': self._ema}
+
+    def _load(self, state):
+        self._count, self._seed_sum, self._ema = state['count'], state['seed_sum'], state['ema']
+
+
+@register_indicator('RSI')
+class RSIIndicator(StreamingIndicator):
+    """
+    Relative Strength Index with Wilder smoothing of gains and losses.
+    """
+    code = 'RSI'
+
+    def __init__(self, **params):
+        super().__init__(**params)
+        self._prev: Optional[float] = None
+        self._count = 0
+        self._gain_sum = 0.0
+        self._loss_sum = 0.0
+        self._avg_gain: Optional[float] = None
+        self._avg_loss: Optional[float] = None
+
+    @staticmethod
+    def _rsi(avg_gain: float, avg_loss: float) -> float:
+        if avg_loss == 0:
+            return 100.0 if avg_gain > 0 else 50.0
+        return 100.0 - 100.0 / (1.0 + avg_gain / avg_loss)
+
+    def update(self, bar):
+        x = self._source(bar)
+        if self._prev is None:
+            self._prev = x
+            return None
+        change, self._prev = x - self._prev, x
+        gain, loss = max(change, 0.0), max(-change, 0.0)
+        self._count += 1
+        n = self.period
+        if self._avg_gain is None:
+            self._gain_sum += gain
+            self._loss_sum += loss
+            if self._count < n:
+                return None
+            self._avg_gain, self._avg_loss = self._gain_sum / n, self._loss_sum / n
+        else:
+            self._avg_gain = (self._avg_gain * (n - 1) + gain) / n
+            self._avg_loss = (self._avg_loss * (n - 1) + loss) / n
+        return {'value': self._rsi(self._avg_gain, self._avg_loss)}
+
+    def warm_up(self, arrays):
+        values = self._source_array(arrays)
+        n = self.period
+        series = np.full(len(values), np.nan)
+        if len(values):
+            self._prev = float(values[-1])
+        changes = np.diff(values)
+        gains, losses = np.clip(changes, 0, None), np.clip(-changes, 0, None)
+        self._count = len(changes)
+        if len(changes) >= n:
+            avg_gain = _seeded_ema(gains, n, 1.0 / n)
+            avg_loss = _seeded_ema(losses, n, 1.0 / n)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                rsi = 100.0 - 100.0 / (1.0 + avg_gain / avg_loss)
+            rsi = np.where(avg_loss == 0, np.where(avg_gain > 0, 100.0, 50.0), rsi)
+            rsi[:n - 1] = np.nan
+            series[1:] = rsi
+            self._avg_gain, self._avg_loss = float(avg_gain[-1]), float(avg_loss[-1])
+        else:
+            self._gain_sum, self._loss_sum = float(gains.sum()), float(losses.sum())
+        return self._finish_warm_up(arrays, {'value': series})
+
+    def _dump(self):
+        return {
+            'prev': self._prev, 'count': self._count, 'gain_sum': self._gain_sum, 'loss_sum': self._loss_sum,
+            'avg_gain': self._avg_gain, 'avg_loss': self._avg_loss,
+        }
+
+    def _load(self, state):
+        self._prev, self._count = state['prev'], state['count']
+        self._gain_sum, self._loss_sum = state['gain_sum'], state['loss_sum']
+        self._avg_gain, self._avg_loss = state['avg_gain'], state['avg_loss']
+
+
+@register_indicator('ATR')
+class ATRIndicator(StreamingIndicator):
+    """
+    Average True Range with Wilder smoothing.
+    """
+    code = 'ATR'
+
+    def __init__(self, **params):
+        super().__init__(**params)
+        self._prev_close: Optional[float] = None
+        self._count = 0
+        self._seed_sum = 0.0
+        self._atr: Optional[float] = None
+
+    def update(self, bar):
+        high, low, close = float(bar['high']), float(bar['low']), float(bar['close'])
+        if self._prev_close is None:
+            true_range = high - low
+        else:
+            true_range = max(high - low, abs(high - self._prev_close), abs(low - self._prev_close))
+        self._prev_close = close
+        self._count += 1
+        n = self.period
+        if self._atr is None:
+            self._seed_sum += true_range
+            if self._count < n:
+                return None
+            self._atr = self._seed_sum / n
+        else:
+            self._atr = (self._atr * (n - 1) + true_range) / n
+        return {'value': self._atr}
+
+    def warm_up(self, arrays):
+        high = np.asarray(arrays.high_price, dtype=np.float64)
+        low = np.asarray(arrays.low_price, dtype=np.float64)
+        close = np.asarray(arrays.close_price, dtype=np.float64)
+        prev_close = np.r_[np.nan, close[:-1]]
+        true_range = np.fmax(high - low, np.fmax(np.abs(high - prev_close), np.abs(low - prev_close)))
+        n = self.period
+        series = _seeded_ema(true_range, n, 1.0 / n)
+        self._count = len(true_range)
+        if len(close):
+            self._prev_close = float(close[-1])
+        if len(true_range) >= n:
+            self._atr = float(series[-1])
+        else:
+            self._seed_sum = float(true_range.sum())
+        return self._finish_warm_up(arrays, {'value': series})
+
+    def _dump(self):
+        return {'prev_close': self._prev_close, 'count': self._count, 'seed_sum': self._seed_sum, 'atr': self._atr}
+
+    def _load(self, state):
+        self._prev_close, self._count = state['prev_close'], state['count']
+        self._seed_sum, self._atr = state['seed_sum'], state['atr']
+
+
+@register_indicator('BBANDS', 'BB', 'BOLLINGER')
+class BollingerBandsIndicator(StreamingIndicator):
+    """
+    Bollinger Bands using a rolling Welford mean/variance (population std).
+    """
+    code = 'BBANDS'
+    # برای جلوگیری از انباشت خطای ممیز شناور، هر چند بار میانگین و واریانس از روی پنجره بازمحاسبه می‌شود
+    RECOMPUTE_EVERY = 10_000
+
+    def __init__(self, **params):
+        super().__init__(**params)
+        self._window = deque(maxlen=self.period)
+        self._mean = 0.0
+        self._m2 = 0.0
+        self._updates = 0
+
+    @property
+    def warmup_bars(self) -> int:
+        return self.period
+
+    @property
+    def num_std(self) -> float:
+        return float(self.params.get('std_dev', self.params.get('num_std', 2.0)))
+
+    def _recompute(self):
+        window = np.fromiter(self._window, dtype=np.float64)
+        self._mean = float(window.mean()) if len(window) else 0.0
+        self._m2 = float(((window - self._mean) ** 2).sum()) if len(window) else 0.0
+
+    def update(self, bar):
+        x = self._source(bar)
+        n = self.period
+        if len(self._window) < n:
+            self._window.append(x)
+            delta = x - self._mean
+            self._mean += delta / len(self._window)
+            self._m2 += delta * (x - self._mean)
+        else:
+            old = self._window[0]
+            self._window.append(x)
+            new_mean = self._mean + (x - old) / n
+            self._m2 += (x - old) * (x - new_mean + old - self._mean)
+            self._mean = new_mean
+        self._updates += 1
+        if self._updates % self.RECOMPUTE_EVERY == 0:
+            self._recompute()
+        if len(self._window) < n:
+            return None
+        std = math.sqrt(max(self._m2, 0.0) / n)
+        return {'middle': self._mean, 'upper': self._mean + self.num_std * std, 'lower': self._mean - self.num_std * std}
+
+    def warm_up(self, arrays):
+        values = self._source_array(arrays)
+        rolling = pd.Series(values).rolling(self.period)
+        middle = rolling.mean().to_numpy()
+        std = rolling.std(ddof=0).to_numpy()
+        self._window = deque(values[-self.period:].tolist(), maxlen=self.period)
+        self._recompute()
+        return self._finish_warm_up(arrays, {
+            'middle': middle,
+            'upper': middle + self.num_std * std,
+            'lower': middle - self.num_std * std,
+        })
+
+    def _checkpoint(self):
+        evicted = self._window[0] if len(self._window) == self.period else None
+        return {'evicted': evicted, 'mean': self._mean, 'm2': self._m2, 'updates': self._updates}
+
+    def _rollback(self, checkpoint):
+        self._window.pop()
+        if checkpoint['evicted'] is not None:
+            self._window.appendleft(checkpoint['evicted'])
+        self._mean, self._m2, self._updates = checkpoint['mean'], checkpoint['m2'], checkpoint['updates']
+
+    def _dump(self):
+        return {'window': list(self._window)}
+
+    def _load(self, state):
+        self._window = deque(state['window'], maxlen=self.period)
+        self._recompute()
+
+
+# --- موتور ---
+
+SeriesKey = Tuple[Any, str] # (instrument_id, timeframe)
+
+
+class IndicatorEngine:
+    """
+    Keeps streaming indicator state per (instrument, timeframe, template) and updates
+    it as candles arrive. States are periodically snapshotted to the cache so a
+    restarted worker resumes without replaying the full history.
+    Templates are subscribed to a series through the shared cache (subscribe()), so the
+    process that ingests candles picks up templates requested from any other process.
+    """
+
+    def __init__(self, snapshot_interval_seconds: Optional[float] = None):
+        self._indicators: Dict[SeriesKey, Dict[Any, StreamingIndicator]] = {}
+        self._lock = threading.RLock()
+        self._snapshot_interval = snapshot_interval_seconds
+        self._last_snapshot_at = time.monotonic()
+        # قالب‌هایی که از طریق اشتراک مشترک ردیابی شده‌اند و زمان آخرین همگام‌سازی هر سری
+        self._subscribed: Dict[SeriesKey, set] = {}
+        self._synced_at: Dict[SeriesKey, float] = {}
+
+    @property
+    def snapshot_interval(self) -> float:
+        if self._snapshot_interval is not None:
+            return self._snapshot_interval
+        return float(getattr(settings, 'INDICATOR_STATE_SNAPSHOT_INTERVAL_SECONDS', 60))
+
+    @property
+    def subscription_refresh_interval(self) -> float:
+        return float(getattr(settings, 'INDICATOR_SUBSCRIPTION_REFRESH_SECONDS', 30))
+
+    @staticmethod
+    def snapshot_key(instrument_id, timeframe: str, template_id) -> str:
+        return f"indicator_state_{instrument_id}_{timeframe}_{template_id}"
+
+    @staticmethod
+    def subscriptions_key(instrument_id, timeframe: str) -> str:
+        return f"indicator_subscriptions_{instrument_id}_{timeframe}"
+
+    def register_template(self, instrument_id, timeframe: str, template, history=None) -> StreamingIndicator:
+        """
+        Starts tracking a template for a series. Restores a snapshot if one exists and
+        replays only newer bars from history; otherwise warms up over history (vectorized).
+        """
+        indicator = self.restore(instrument_id, timeframe, template)
+        restored = indicator is not None
+        if not restored:
+            indicator = get_indicator_class(template.indicator.code)(**resolve_template_parameters(template))
+        self._advance(indicator, history, restored)
+        with self._lock:
+            self._indicators.setdefault((instrument_id, timeframe), {})[template.id] = indicator
+        return indicator
+
+    def build_indicator(self, instrument_id, timeframe: str, template) -> StreamingIndicator:
+        """
+        Builds a template's state without tracking it: restores its snapshot and replays the
+        bars stored since, or warms up over only the last `warmup_bars` stored bars.
+        """
+        indicator = self.restore(instrument_id, timeframe, template)
+        restored = indicator is not None
+        if not restored:
+            indicator = get_indicator_class(template.indicator.code)(**resolve_template_parameters(template))
+        history = load_indicator_history(instrument_id, timeframe, bars=indicator.warmup_bars,
+                                         since_ts=indicator.last_ts if restored else None)
+        return self._advance(indicator, history, restored)
+
+    @staticmethod
+    def _advance(indicator: StreamingIndicator, history, restored: bool) -> StreamingIndicator:
+        if history is None or not len(history):
+            return indicator
+        if not restored:
+            # آخرین کندل ممکن است هنوز باز باشد؛ جداگانه اعمال می‌شود تا به‌روزرسانی‌هایش جایگزین آن شوند
+            indicator.warm_up(history.slice_range(None, int(history.timestamp[-1]) - 1))
+            indicator.on_bar(_bar_at(history, len(history) - 1))
+            return indicator
+        start = int(np.searchsorted(history.timestamp, indicator.last_ts, side='right')) if indicator.last_ts is not None else 0
+        for index in range(start, len(history)):
+            indicator.on_bar(_bar_at(history, index))
+        return indicator
+
+    def unregister_template(self, instrument_id, timeframe: str, template_id):
+        with self._lock:
+            self._indicators.get((instrument_id, timeframe), {}).pop(template_id, None)
+
+    def is_tracking(self, instrument_id, timeframe: str, template_id) -> bool:
+        with self._lock:
+            return template_id in self._indicators.get((instrument_id, timeframe), {})
+
+    def on_candle(self, instrument_id, timeframe: str, bar: Dict[str, float]) -> Dict[Any, Optional[Dict[str, float]]]:
+        """
+        Updates every tracked template of the series with one bar (O(1) each); repeated
+        updates of the open bar replace it.
+        Returns {template_id: latest output}.
+        """
+        if time.monotonic() - self._synced_at.get((instrument_id, timeframe), float('-inf')) >= self.subscription_refresh_interval:
+            self.sync_subscriptions(instrument_id, timeframe)
+        with self._lock:
+            indicators = dict(self._indicators.get((instrument_id, timeframe), {}))
+            results = {template_id: indicator.on_bar(bar) for template_id, indicator in indicators.items()}
+        if indicators and time.monotonic() - self._last_snapshot_at >= self.snapshot_interval:
+            self.save_snapshots()
+        return results
+
+    def get_value(self, instrument_id, timeframe: str, template_id) -> Optional[Dict[str, float]]:
+        with self._lock:
+            indicator = self._indicators.get((instrument_id, timeframe), {}).get(template_id)
+            return indicator.value if indicator else None
+
+    # --- اشتراک مشترک بین پروسس‌ها ---
+    def subscribe(self, instrument_id, timeframe: str, template_id):
+        """
+        Adds a template to the shared subscription list of a series; the process that
+        ingests the series starts tracking it on its next sync.
+        """
+        from apps.core.cache import CacheService # Import داخل تابع برای جلوگیری از حلقه
+
+        key = self.subscriptions_key(instrument_id, timeframe)
+        subscribed = self._read_subscriptions(key)
+        if template_id in subscribed:
+            return
+        # خواندن-تغییر-نوشتن اتمیک نیست؛ اشتراکی که در رقابت گم شود با اجرای بعدی تسک دوباره ثبت می‌شود
+        ttl = int(getattr(settings, 'INDICATOR_STATE_SNAPSHOT_TTL_SECONDS', 7 * 24 * 3600))
+        CacheService.set_cached_value(key, sorted(subscribed | {template_id}), ttl_seconds=ttl, use_db_cache=True)
+
+    def sync_subscriptions(self, instrument_id, timeframe: str) -> int:
+        """
+        Starts tracking active templates subscribed to the series and stops tracking the
+        ones whose subscription is gone. Returns the number of templates started.
+        """
+        series = (instrument_id, timeframe)
+        self._synced_at[series] = time.monotonic()
+        try:
+            subscribed = self._read_subscriptions(self.subscriptions_key(instrument_id, timeframe))
+        except Exception as e:
+            logger.warning(f"Could not read indicator subscriptions for {instrument_id} ({timeframe}): {str(e)}")
+            return 0
+        with self._lock:
+            tracked = set(self._indicators.get(series, {}))
+            previous = self._subscribed.get(series, set())
+        # فقط قالب‌هایی که از طریق اشتراک اضافه شده‌اند حذف می‌شوند (نه register_template مستقیم)
+        for template_id in previous - subscribed:
+            self.unregister_template(instrument_id, timeframe, template_id)
+        started = set()
+        for template in self._load_templates(subscribed - tracked):
+            try:
+                indicator = self.build_indicator(instrument_id, timeframe, template)
+            except Exception as e:
+                logger.error(f"Error starting indicator template {template.id} for {instrument_id} ({timeframe}): {str(e)}")
+                continue
+            with self._lock:
+                self._indicators.setdefault(series, {})[template.id] = indicator
+            started.add(template.id)
+        with self._lock:
+            self._subscribed[series] = (previous & subscribed) | started
+        return len(started)
+
+    @staticmethod
+    def _read_subscriptions(key: str) -> set:
+        from apps.core.cache import CacheService # Import داخل تابع برای جلوگیری از حلقه
+
+        data = CacheService.get_cached_value(key)
+        if isinstance(data, str):
+            data = json.loads(data)
+        return set(data or [])
+
+    @staticmethod
+    def _load_templates(template_ids) -> list:
+        if not template_ids:
+            return []
+        from .models import IndicatorTemplate # Import داخل تابع برای جلوگیری از حلقه
+
+        return list(IndicatorTemplate.objects.select_related('indicator').filter(id__in=template_ids, is_active=True))
+
+    # --- snapshot ---
+    def save_snapshot(self, instrument_id, timeframe: str, template_id, indicator: StreamingIndicator):
+        """
+        Writes one state to the cache (with DB fallback), e.g. a state built outside the engine.
+        """
+        from apps.core.cache import CacheService # Import داخل تابع برای جلوگیری از حلقه
+
+        ttl = int(getattr(settings, 'INDICATOR_STATE_SNAPSHOT_TTL_SECONDS', 7 * 24 * 3600))
+        CacheService.set_cached_value(self.snapshot_key(instrument_id, timeframe, template_id), indicator.get_state(),
+                                      ttl_seconds=ttl, use_db_cache=True)
+
+    def save_snapshots(self) -> int:
+        """
+        Writes every tracked state to the cache (with DB fallback). Returns the number saved.
+        """
+        from apps.core.cache import CacheService # Import داخل تابع برای جلوگیری از حلقه
+
+        ttl = int(getattr(settings, 'INDICATOR_STATE_SNAPSHOT_TTL_SECONDS', 7 * 24 * 3600))
+        with self._lock:
+            items = [
+                (self.snapshot_key(instrument_id, timeframe, template_id), indicator.get_state())
+                for (instrument_id, timeframe), indicators in self._indicators.items()
+                for template_id, indicator in indicators.items()
+            ]
+            self._last_snapshot_at = time.monotonic()
+        for key, state in items:
+            try:
+                CacheService.set_cached_value(key, state, ttl_seconds=ttl, use_db_cache=True)
+            except Exception as e:
+                logger.error(f"Error saving indicator state snapshot '{key}': {str(e)}")
+        logger.debug(f"Saved {len(items)} indicator state snapshots.")
+        return len(items)
+
+    def restore(self, instrument_id, timeframe: str, template) -> Optional[StreamingIndicator]:
+        from apps.core.cache import CacheService # Import داخل تابع برای جلوگیری از حلقه
+
+        key = self.snapshot_key(instrument_id, timeframe, template.id)
+        try:
+            data = CacheService.get_cached_value(key)
+            if data is None:
+                return None
+            if isinstance(data, str):
+                data = json.loads(data)
+            if data.get('code') != get_indicator_class(template.indicator.code).code or data.get('params') != resolve_template_parameters(template):
+                return None # قالب تغییر کرده است؛ گرم‌کردن مجدد لازم است
+            return StreamingIndicator.from_state(data)
+        except Exception as e:
+            logger.warning(f"Could not restore indicator state '{key}': {str(e)}")
+            return None
+
+
+def load_indicator_history(instrument_id, timeframe: str, bars: int, since_ts: Optional[int] = None):
+    """
+    OHLCV arrays of a series from since_ts (epoch ms) on, or its last `bars` bars
+    (a time window, so gaps in the series yield fewer bars). Returns None without an OHLCV config.
+    """
+    from apps.market_data.models import MarketDataConfig, MarketDataSnapshot # Import داخل تابع برای جلوگیری از حلقه
+    from apps.market_data.resampling import timeframe_to_ms
+    from apps.market_data.storage import OHLCVArrays, load_ohlcv_arrays, to_epoch_ms
+
+    config = MarketDataConfig.objects.filter(instrument_id=instrument_id, timeframe=timeframe, data_type='OHLCV').first()
+    if config is None:
+        return None
+    if since_ts is None:
+        latest = MarketDataSnapshot.objects.filter(config=config).order_by('-timestamp').values_list('timestamp', flat=True).first()
+        if latest is None:
+            return OHLCVArrays.empty()
+        since_ts = to_epoch_ms(latest) - (bars - 1) * timeframe_to_ms(timeframe)
+    return load_ohlcv_arrays(config, start=since_ts)
+
+
+def _bar_at(arrays, index: int) -> Dict[str, float]:
+    return {
+        'timestamp': int(arrays.timestamp[index]),
+        'open': float(arrays.open_price[index]),
+        'high': float(arrays.high_price[index]),
+        'low': float(arrays.low_price[index]),
+        'close': float(arrays.close_price[index]),
+        'volume': float(arrays.volume[index]),
+    }
+
+
+# موتور سراسری در سطح پروسس
+indicator_engine = IndicatorEngine()
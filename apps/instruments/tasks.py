@@ -150,7 +150,7 @@ def cleanup_expired_watchlists_task():
 
 
 @shared_task(bind=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 1})
-def process_instrument_metadata_update_task(self, instrument_id: int, metadata_update_ dict):
+def process_instrument_metadata_update_task(self, instrument_id: int, metadata_update_dict: dict):
     """
     Asynchronously updates the metadata JSON field of an instrument.
     Useful for bulk updates or updates triggered by external events/data feeds.
@@ -227,59 +227,58 @@ def aggregate_instrument_statistics_task(instrument_id: int, period: str = '24h'
 
 # --- تاسک‌های مرتبط با Indicator ---
 @shared_task(bind=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 2, 'countdown': 10})
-def calculate_indicator_for_instrument_task(self, indicator_template_id: int, instrument_id: int, data_range: str = 'recent'):
+def calculate_indicator_for_instrument_task(self, indicator_template_id: int, instrument_id: int, data_range: str = 'recent', timeframe: str = None):
     """
     Task to calculate an indicator based on a template for a specific instrument.
-    This would typically fetch recent price data and apply the indicator's logic.
+    Builds the streaming state from the shared snapshot (or a warm-up bounded to the bars the
+    template needs), saves it and subscribes the template, so the process that ingests candles
+    keeps it updated incrementally.
     """
     try:
-        from apps.market_data.services import MarketDataService # فرض بر این است که وجود دارد
-        from apps.market_data.models import MarketDataSnapshot # فرض بر این است که وجود دارد
+        from apps.market_data.models import MarketDataConfig, MarketDataSnapshot # فرض بر این است که وجود دارد
+        from apps.market_data.storage import to_epoch_ms
+        from apps.core.cache import indicator_result_cache
+        from .indicator_engine import indicator_engine, resolve_template_parameters
 
         template = IndicatorTemplate.objects.select_related('indicator').get(id=indicator_template_id)
         instrument = Instrument.objects.get(id=instrument_id)
-
-        logger.info(f"Calculating indicator '{template.indicator.name}' for instrument '{instrument.symbol}' using template '{template.name}'.")
-
-        # 1. گرفتن داده‌های قیمت
-        # مثلاً گرفتن آخرین 100 کندل
-        num_periods = 100
-        if data_range == 'recent':
-            price_data = MarketDataSnapshot.objects.filter(
-                instrument=instrument
-            ).order_by('-timestamp')[:num_periods]
-        else:
-             # می‌توانید بازه زمانی دلخواه دیگری را نیز پشتیبانی کنید
-             logger.warning(f"Data range '{data_range}' not fully implemented in task. Using 'recent'.")
-             price_data = MarketDataSnapshot.objects.filter(
-                 instrument=instrument
-             ).order_by('-timestamp')[:num_periods]
-
-        if not price_data.exists():
-             logger.warning(f"No price data found for instrument {instrument.symbol} to calculate indicator '{template.indicator.name}'.")
-             return None
-
-        # تبدیل QuerySet به لیست یا دیکشنری مناسب برای محاسبات
-        ohlcv_list = [(s.timestamp, s.open_price, s.high_price, s.low_price, s.close_price, s.volume) for s in price_data]
-
-        # 2. استفاده از منطق محاسباتی اندیکاتور
-        # این بخش بستگی به این دارد که چگونه منطق اندیکاتورها پیاده‌سازی شده‌اند
-        # فرض بر این است که یک سرویس یا کتابخانه خارجی وجود دارد که این کار را انجام می‌دهد
-        # مثلاً:
-        # from apps.analytics.indicator_calculator import run_calculation
-        # result = run_calculation(template.indicator.code, ohlcv_list, template.parameters)
-
-        # 3. ذخیره نتیجه (مثلاً در یک مدل جدید یا کش)
-        # from apps.analytics.models import IndicatorResult
-        # IndicatorResult.objects.create(
-        #     template=template,
-        #     instrument=instrument,
-        #     calculated_at=timezone.now(),
-        #     result_data=result # ممکن است JSON یا یک فیلد دیگر باشد
-        # )
+        timeframe = timeframe or template.indicator.calculation_frequency
+
+        logger.info(f"Calculating indicator '{template.indicator.name}' for instrument '{instrument.symbol}' ({timeframe}) using template '{template.name}'.")
+
+        if data_range != 'recent':
+            logger.warning(f"Data range '{data_range}' not fully implemented in task. Using the latest value.")
+
+        # 1. آخرین کندل ذخیره‌شده (کلید نتیجه مشترک)
+        config = MarketDataConfig.objects.filter(instrument=instrument, timeframe=timeframe, data_type='OHLCV').first()
+        if config is None:
+            logger.warning(f"No OHLCV config found for instrument {instrument.symbol} ({timeframe}) to calculate indicator '{template.indicator.name}'.")
+            return None
+        latest = MarketDataSnapshot.objects.filter(config=config).order_by('-timestamp').values_list('timestamp', flat=True).first()
+        if latest is None:
+            logger.warning(f"No price data found for instrument {instrument.symbol} to calculate indicator '{template.indicator.name}'.")
+            return None
+
+        # 2. بازیابی snapshot مشترک و اعمال کندل‌های جدیدتر، یا گرم‌کردن روی warmup_bars کندل آخر؛
+        # نتیجه برای ترکیب یکسان (سری، کد، پارامترها، آخرین کندل) بین همه مصرف‌کننده‌ها به اشتراک گذاشته می‌شود
+        def compute():
+            indicator = indicator_engine.build_indicator(instrument.id, timeframe, template)
+            indicator_engine.save_snapshot(instrument.id, timeframe, template.id, indicator)
+            return indicator.value
+
+        value = indicator_result_cache.get_or_compute(
+            instrument.id,
+            timeframe,
+            template.indicator.code,
+            resolve_template_parameters(template),
+            to_epoch_ms(latest),
+            compute,
+        )
+        # 3. پروسس دریافت کندل‌ها از این پس قالب را به‌صورت افزایشی به‌روز می‌کند
+        indicator_engine.subscribe(instrument.id, timeframe, template.id)
 
         logger.info(f"Calculated indicator '{template.indicator.name}' for instrument '{instrument.symbol}' successfully.")
-        # return result # اگر نیاز به بازگرداندن خروجی محاسبه است
+        return value
 
     except IndicatorTemplate.DoesNotExist:
         logger.error(f"IndicatorTemplate with ID {indicator_template_id} not found for calculation task.")
@@ -12,6 +12,7 @@ from .models import (
     MarketDataTick,
     MarketDataSyncLog,
     MarketDataCache,
+    MarketDataCoverage,
 )
 
 
@@ -207,3 +208,21 @@ class MarketDataCacheAdmin(admin.ModelAdmin):
     config_instrument.short_description = 'Instrument (TF)'
 
 admin.site.register(MarketDataCache, MarketDataCacheAdmin)
+
+
+class MarketDataCoverageAdmin(admin.ModelAdmin):
+    list_display = ('config_instrument', 'bar_count', 'interval_count', 'updated_at')
+    list_filter = ('config__data_source__name', 'config__timeframe')
+    search_fields = ('config__instrument__symbol',)
+    raw_id_fields = ('config',)
+    readonly_fields = ('created_at', 'updated_at', 'bar_count', 'intervals', 'empty_intervals')
+
+    def config_instrument(self, obj):
+        return f"{obj.config.instrument.symbol} ({obj.config.timeframe})"
+    config_instrument.short_description = 'Instrument (TF)'
+
+    def interval_count(self, obj):
+        return len(obj.intervals or [])
+    interval_count.short_description = 'Intervals'
+
+admin.site.register(MarketDataCoverage, MarketDataCoverageAdmin)
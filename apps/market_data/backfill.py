@@ -0,0 +1,411 @@
+# apps/market_data/backfill.py
+
+"""
+Historical OHLCV backfill.
+
+A (config, start, end) range is split into chunks of one REST page each. Chunks are fetched
+concurrently by a thread pool under the data source's request-weight budget (token bucket of
+apps.connectors.rate_limiter) and written by the calling thread with bulk upserts on
+(config, timestamp). Completed chunks are checkpointed in MarketDataSyncLog.details['backfill'],
+so a crashed or retried run resumes where it stopped. find_gaps() asks the coverage index
+(apps.market_data.coverage) for missing candles so they can be backfilled the same way; closed
+ranges the source returned nothing for are recorded as empty there and not requested again.
+"""
+
+import json
+import logging
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from decimal import Decimal
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from django.utils import timezone
+
+from apps.core.metrics import metrics
+from .resampling import timeframe_to_ms
+from .storage import from_epoch_ms
+
+logger = logging.getLogger(__name__)
+
+METRIC_PREFIX = 'market_data.backfill'
+
+# تنظیمات پیش‌فرض؛ هر DataSource می‌تواند در config['backfill'] آن‌ها را بازنویسی کند
+DEFAULT_BACKFILL = {
+    'concurrency': 4,               # تعداد درخواست‌های هم‌زمان
+    'chunk_candles': None,          # None -> سقف صفحه پروتکل صرافی
+    'default_lookback_days': 1,     # بازه پیش‌فرض وقتی هیچ داده‌ای ذخیره نشده است
+    'max_retries': 3,               # تلاش مجدد هر chunk
+    'retry_backoff_seconds': 1.0,
+    'request_timeout_seconds': 10,
+}
+
+SNAPSHOT_UPSERT_FIELDS = [
+    'open_price', 'high_price', 'low_price', 'close_price', 'volume', 'quote_volume',
+    'number_of_trades', 'taker_buy_base_asset_volume', 'taker_buy_quote_asset_volume',
+]
+
+
+def get_backfill_settings(data_source) -> Dict[str, Any]:
+    """
+    Returns the effective backfill settings for a DataSource
+    (defaults merged with data_source.config['backfill']).
+    """
+    merged = dict(DEFAULT_BACKFILL)
+    source_config = getattr(data_source, 'config', None) or {}
+    overrides = source_config.get('backfill') or {}
+    if isinstance(overrides, dict):
+        merged.update(overrides)
+    merged['concurrency'] = max(1, int(merged['concurrency']))
+    merged['max_retries'] = max(0, int(merged['max_retries']))
+    return merged
+
+
+# --- فشرده‌سازی لیست chunkهای کامل‌شده برای checkpoint ---
+
+def indexes_to_ranges(indexes: Iterable[int]) -> List[List[int]]:
+    """
+    [0, 1, 2, 5, 6] -> [[0, 2], [5, 6]] (inclusive ranges).
+    """
+    ranges: List[List[int]] = []
+    for index in sorted(set(indexes)):
+        if ranges and index == ranges[-1][1] + 1:
+            ranges[-1][1] = index
+        else:
+            ranges.append([index, index])
+    return ranges
+
+
+def ranges_to_indexes(ranges: Iterable[Iterable[int]]) -> set:
+    indexes = set()
+    for first, last in ranges or []:
+        indexes.update(range(int(first), int(last) + 1))
+    return indexes
+
+
+def split_range(start_ms: int, end_ms: int, timeframe_ms: int, chunk_candles: int) -> List[Tuple[int, int]]:
+    """
+    Splits [start_ms, end_ms) into bar-aligned chunks of at most chunk_candles candles.
+    """
+    start_ms = (int(start_ms) // timeframe_ms) * timeframe_ms
+    span = timeframe_ms * chunk_candles
+    return [(chunk_start, min(chunk_start + span, end_ms)) for chunk_start in range(start_ms, int(end_ms), span)]
+
+
+def missing_ranges(timestamps: np.ndarray, start_ms: int, end_ms: int, timeframe_ms: int) -> List[Tuple[int, int]]:
+    """
+    [start, end) ranges of bars in [start_ms, end_ms) that are absent from timestamps (epoch ms).
+    """
+    start_ms = (int(start_ms) // timeframe_ms) * timeframe_ms
+    timestamps = np.unique(np.asarray(timestamps, dtype=np.int64))
+    timestamps = timestamps[(timestamps >= start_ms) & (timestamps < end_ms)]
+    # مرزها به عنوان کندل‌های مجازی اضافه می‌شوند تا شکاف ابتدا و انتهای بازه هم دیده شود
+    bounds = np.concatenate(([start_ms - timeframe_ms], timestamps, [((int(end_ms) - 1) // timeframe_ms + 1) * timeframe_ms]))
+    steps = np.diff(bounds)
+    gaps = np.nonzero(steps > timeframe_ms)[0]
+    return [(int(bounds[i] + timeframe_ms), int(bounds[i + 1])) for i in gaps]
+
+
+# --- دریافت و ذخیره ---
+
+def fetch_rest_klines(config, start_ms: int, end_ms: int, limit: int, timeout: float = 10) -> List[Dict]:
+    """
+    Fetches one page of candles over REST using the data source's stream protocol.
+    """
+    from apps.connectors.transport import HTTP_TRANSPORT_AVAILABLE, http_request_sync # Import داخل تابع برای جلوگیری از حلقه
+    from .streams import get_source_code, get_stream_protocol
+
+    protocol = get_stream_protocol(get_source_code(config.data_source))
+    url = protocol.klines_url(config, start_ms, end_ms, limit) if protocol else None
+    if not url:
+        raise ValueError(f"Data source {config.data_source.name} has no REST klines endpoint.")
+    if HTTP_TRANSPORT_AVAILABLE:
+        # اتصال‌های keep-alive مشترک؛ تکرار و محدودیت نرخ را خود موتور backfill انجام می‌دهد
+        payload = http_request_sync('GET', url, timeout=timeout, retries=0).raise_for_status().json()
+    else:
+        from urllib.request import urlopen
+        with urlopen(url, timeout=timeout) as response:
+            payload = json.loads(response.read())
+    return protocol.parse_klines(payload)
+
+
+def _decimal(value) -> Optional[Decimal]:
+    return Decimal(str(value)) if value is not None else None
+
+
+def upsert_candles(config, candles: List[Dict]) -> int:
+    """
+    Bulk upserts candles (epoch ms timestamps) on (config, timestamp) and runs the snapshot post-persist hooks.
+    """
+    if not candles:
+        return 0
+    from .models import MarketDataSnapshot # Import داخل تابع برای جلوگیری از حلقه
+    from .services import MarketDataService
+
+    rows = [
+        MarketDataSnapshot(
+            config=config,
+            timestamp=from_epoch_ms(candle['timestamp']),
+            open_price=_decimal(candle['open']),
+            high_price=_decimal(candle['high']),
+            low_price=_decimal(candle['low']),
+            close_price=_decimal(candle['close']),
+            volume=_decimal(candle['volume']),
+            quote_volume=_decimal(candle.get('quote_volume')),
+            number_of_trades=candle.get('number_of_trades'),
+            taker_buy_base_asset_volume=_decimal(candle.get('taker_buy_base_asset_volume')),
+            taker_buy_quote_asset_volume=_decimal(candle.get('taker_buy_quote_asset_volume')),
+        )
+        for candle in candles
+    ]
+    MarketDataSnapshot.objects.bulk_create(
+        rows,
+        batch_size=1000,
+        update_conflicts=True,
+        unique_fields=['config', 'timestamp'],
+        update_fields=SNAPSHOT_UPSERT_FIELDS,
+    )
+
+    # همان پردازش‌های پس از ذخیره مسیر زنده (کندل‌های تاریخی به کش داغ نمی‌روند)
+    MarketDataService.run_snapshot_hooks(config, rows, update_hot_cache=False)
+    return len(rows)
+
+
+def _source_exchange(data_source):
+    """
+    Exchange behind a DataSource (matched on its code or name), or None.
+    """
+    from django.db.models import Q
+    from apps.exchanges.models import Exchange # Import داخل تابع برای جلوگیری از حلقه
+    from .streams import get_source_code
+
+    return (
+        Exchange.objects.select_related('connector_config')
+        .filter(Q(code__iexact=get_source_code(data_source)) | Q(name__iexact=data_source.name))
+        .first()
+    )
+
+
+def _rate_limit_specs(config, weight: int):
+    """
+    IP-weight bucket of the source's exchange, keyed and sized exactly like the exchange
+    connectors (ip_bucket_key(exchange.id), ExchangeConnectorConfig.rate_limit_per_minute),
+    so backfills and live connectors draw from one budget.
+    """
+    from apps.connectors.models import ExchangeConnectorConfig # Import داخل تابع برای جلوگیری از حلقه
+    from apps.connectors.rate_limiter import BucketSpec, ip_bucket_key
+    from .streams import get_source_code
+
+    exchange = _source_exchange(config.data_source)
+    if exchange is None:
+        # منبعی که صرافی متناظر ندارد: باکت جداگانه بر اساس محدودیت خود DataSource
+        per_minute = max(1, int(config.data_source.rate_limit_per_minute or 1200))
+        return [BucketSpec(ip_bucket_key(get_source_code(config.data_source)), per_minute, per_minute / 60.0, weight)]
+    try:
+        per_minute = exchange.connector_config.rate_limit_per_minute
+    except ExchangeConnectorConfig.DoesNotExist:
+        per_minute = 1200 # مقدار پیش‌فرض مدل (مانند کانکتورها)
+    return [BucketSpec(ip_bucket_key(exchange.id), per_minute, per_minute / 60.0, weight)]
+
+
+# --- موتور backfill ---
+
+class BackfillEngine:
+    """
+    Fetches a config's candles for a time range concurrently, resumably and under the rate limit.
+    """
+
+    def __init__(self, fetcher: Optional[Callable] = None, writer: Optional[Callable] = None,
+                 gap_finder: Optional[Callable] = None, empty_recorder: Optional[Callable] = None,
+                 rate_limiter=None, rate_limit_specs: Optional[Callable] = None, clock=time.monotonic,
+                 wall_clock=time.time, sleep=time.sleep, rng: Optional[random.Random] = None):
+        self._fetcher = fetcher or fetch_rest_klines
+        self._writer = writer or upsert_candles
+        self._gap_finder = gap_finder
+        self._empty_recorder = empty_recorder
+        self._wall_clock = wall_clock
+        self._rate_limiter = rate_limiter
+        self._rate_limit_specs = rate_limit_specs or _rate_limit_specs
+        self._clock = clock
+        self._sleep = sleep
+        self._rng = rng or random.Random()
+
+    @property
+    def rate_limiter(self):
+        if self._rate_limiter is None:
+            from apps.connectors.rate_limiter import rate_limiter # Import داخل تابع برای جلوگیری از حلقه
+            self._rate_limiter = rate_limiter
+        return self._rate_limiter
+
+    @staticmethod
+    def _protocol_limits(config) -> Tuple[int, int]:
+        from .streams import get_source_code, get_stream_protocol # Import داخل تابع برای جلوگیری از حلقه
+        protocol = get_stream_protocol(get_source_code(config.data_source))
+        if protocol is None:
+            return 500, 1
+        return protocol.klines_page_limit, protocol.klines_request_weight
+
+    def find_gaps(self, config, start_ms: int, end_ms: int) -> List[Tuple[int, int]]:
+        """
+        Ranges of candles missing from storage in [start_ms, end_ms).
+        """
+        if self._gap_finder is None:
+            from .coverage import get_missing_ranges # Import داخل تابع برای جلوگیری از حلقه
+            self._gap_finder = get_missing_ranges
+        return self._gap_finder(config, start_ms, end_ms)
+
+    def _record_empty(self, config, chunk: Tuple[int, int], candles: List[Dict], timeframe_ms: int):
+        """
+        Records the parts of a closed chunk the source returned no candles for as empty.
+        """
+        # فقط بازه‌های بسته ثبت می‌شوند؛ کندل‌های اخیر ممکن است هنوز در صرافی منتشر نشده باشند
+        closed_until = min(chunk[1], int(self._wall_clock() * 1000) - timeframe_ms)
+        if closed_until <= chunk[0]:
+            return
+        timestamps = np.array([candle['timestamp'] for candle in candles], dtype=np.int64)
+        empty = missing_ranges(timestamps, chunk[0], closed_until, timeframe_ms)
+        if not empty:
+            return
+        if self._empty_recorder is None:
+            from .coverage import record_empty_ranges # Import داخل تابع برای جلوگیری از حلقه
+            self._empty_recorder = record_empty_ranges
+        try:
+            self._empty_recorder(config, empty)
+        except Exception as e:
+            logger.error(f"Error recording empty ranges of config {config.id}: {str(e)}")
+
+    def _fetch_chunk(self, config, chunk: Tuple[int, int], page_limit: int, specs: List, options: Dict) -> List[Dict]:
+        """
+        Fetches every candle of one chunk (several pages if the source returns short pages), with retries.
+        """
+        from .streams import backoff_delay # Import داخل تابع برای جلوگیری از حلقه
+
+        timeframe_ms = timeframe_to_ms(config.timeframe)
+        start_ms, end_ms = chunk
+        candles: List[Dict] = []
+        cursor = start_ms
+        attempt = 0
+        while cursor < end_ms:
+            self.rate_limiter.acquire(specs)
+            try:
+                page = self._fetcher(config, cursor, end_ms - 1, page_limit, options['request_timeout_seconds'])
+            except Exception:
+                if attempt >= options['max_retries']:
+                    raise
+                metrics.incr(f'{METRIC_PREFIX}.retries')
+                self._sleep(backoff_delay(attempt, options['retry_backoff_seconds'], 30.0, self._rng))
+                attempt += 1
+                continue
+            page = [candle for candle in page if cursor <= candle['timestamp'] < end_ms]
+            if not page:
+                break # صرافی برای باقی این بازه کندلی ندارد (مثلاً توقف بازار)
+            candles.extend(page)
+            cursor = page[-1]['timestamp'] + timeframe_ms
+        return candles
+
+    def run(self, config, sync_log, start_ms: Optional[int] = None, end_ms: Optional[int] = None,
+            ranges: Optional[List[Tuple[int, int]]] = None) -> Dict[str, Any]:
+        """
+        Backfills [start_ms, end_ms) (or explicit `ranges`) and checkpoints into sync_log.details['backfill'].
+        A sync log that already holds a checkpoint is resumed: its range is reused and finished chunks are skipped.
+        """
+        options = get_backfill_settings(config.data_source)
+        timeframe_ms = timeframe_to_ms(config.timeframe)
+        page_limit, weight = self._protocol_limits(config)
+        # باکت‌ها یک بار برای هر اجرا تعیین می‌شوند
+        specs = self._rate_limit_specs(config, weight)
+        chunk_candles = int(options['chunk_candles'] or page_limit)
+
+        state = dict((sync_log.details or {}).get('backfill') or {})
+        if state.get('chunks'):
+            chunks = [tuple(chunk) for chunk in state['chunks']]
+        else:
+            if ranges is None:
+                ranges = [(start_ms, end_ms)]
+            chunks = [chunk for range_start, range_end in ranges
+                      for chunk in split_range(range_start, range_end, timeframe_ms, chunk_candles)]
+            state = {
+                'chunks': [list(chunk) for chunk in chunks],
+                'completed': [],
+                'candles': 0,
+            }
+        completed = ranges_to_indexes(state.get('completed'))
+        pending = [index for index in range(len(chunks)) if index not in completed]
+        failed: Dict[int, str] = {}
+        candles_total = int(state.get('candles', 0))
+        started_at = self._clock()
+        candles_this_run = 0
+
+        def checkpoint(status: str):
+            elapsed = max(self._clock() - started_at, 1e-9)
+            state.update({
+                'completed': indexes_to_ranges(completed),
+                'failed': indexes_to_ranges(failed),
+                'candles': candles_total,
+                'progress': round(100.0 * len(completed) / len(chunks), 2) if chunks else 100.0,
+                'candles_per_second': round(candles_this_run / elapsed, 1),
+            })
+            details = dict(sync_log.details or {})
+            details['backfill'] = state
+            sync_log.details = details
+            sync_log.records_synced = candles_total
+            sync_log.status = status
+            sync_log.end_time = timezone.now()
+            sync_log.save(update_fields=['details', 'records_synced', 'status', 'end_time'])
+
+        logger.info(
+            f"Backfill of config {config.id} ({config.timeframe}): {len(pending)} of {len(chunks)} chunks pending, "
+            f"concurrency {options['concurrency']}."
+        )
+        with ThreadPoolExecutor(max_workers=options['concurrency'], thread_name_prefix='backfill') as executor:
+            remaining = iter(pending)
+            in_flight = {}
+
+            def submit_next():
+                index = next(remaining, None)
+                if index is not None:
+                    in_flight[executor.submit(self._fetch_chunk, config, chunks[index], page_limit, specs, options)] = index
+
+            # فقط به اندازه concurrency درخواست در جریان است تا حافظه با طول بازه رشد نکند
+            for _ in range(options['concurrency']):
+                submit_next()
+            while in_flight:
+                done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = in_flight.pop(future)
+                    try:
+                        candles = future.result()
+                        # نوشتن در نخ فراخوان انجام می‌شود (اتصال پایگاه داده نخ‌ها جدا نمی‌شود)
+                        written = self._writer(config, candles)
+                        self._record_empty(config, chunks[index], candles, timeframe_ms)
+                    except Exception as e:
+                        failed[index] = str(e)
+                        metrics.incr(f'{METRIC_PREFIX}.failed_chunks')
+                        logger.error(f"Backfill chunk {chunks[index]} of config {config.id} failed: {e}")
+                    else:
+                        completed.add(index)
+                        candles_total += written
+                        candles_this_run += written
+                        metrics.incr(f'{METRIC_PREFIX}.candles', written)
+                        checkpoint('PARTIAL')
+                    submit_next()
+
+        elapsed = max(self._clock() - started_at, 1e-9)
+        metrics.observe(f'{METRIC_PREFIX}.candles_per_second', candles_this_run / elapsed)
+        state.pop('errors', None)
+        checkpoint('PARTIAL' if failed else 'SUCCESS')
+        if failed:
+            state['errors'] = {str(index): error for index, error in list(failed.items())[:20]}
+            sync_log.details['backfill'] = state
+            sync_log.error_message = f"{len(failed)} of {len(chunks)} backfill chunks failed; rerun to resume."
+            sync_log.save(update_fields=['details', 'error_message'])
+        logger.info(
+            f"Backfill of config {config.id} finished: {candles_this_run} candles in {elapsed:.1f}s "
+            f"({candles_this_run / elapsed:.0f} candles/s), {len(failed)} failed chunks."
+        )
+        return state
+
+
+# موتور سراسری backfill در سطح پروسس
+backfill_engine = BackfillEngine()
@@ -0,0 +1,310 @@
+# apps/market_data/coverage.py
+
+"""
+Coverage index of OHLCV series.
+
+For every config a MarketDataCoverage row keeps the bar timestamps that exist as a sorted set
+of disjoint half-open intervals [start_ms, end_ms), plus ranges the exchange confirmed to be
+empty (e.g. trading halts) so they are not reported or backfilled again. The index is updated
+incrementally when candles are stored; "missing ranges between T1 and T2" is a binary search
+plus a walk over the intervals inside the window, without touching the candle table.
+"""
+
+import logging
+import threading
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from django.db import transaction
+
+from apps.core.metrics import metrics
+from .resampling import timeframe_to_ms
+from .storage import to_epoch_ms
+
+logger = logging.getLogger(__name__)
+
+METRIC_PREFIX = 'market_data.coverage'
+
+
+class IntervalSet:
+    """
+    Sorted disjoint half-open intervals; touching intervals are merged.
+    """
+    __slots__ = ('starts', 'ends')
+
+    def __init__(self, intervals: Optional[Iterable[Iterable[int]]] = None):
+        self.starts: List[int] = []
+        self.ends: List[int] = []
+        for start, end in intervals or []:
+            self.add(int(start), int(end))
+
+    def __len__(self):
+        return len(self.starts)
+
+    def add(self, start: int, end: int) -> int:
+        """
+        Adds [start, end); returns the length that was not covered before.
+        """
+        if end <= start:
+            return 0
+        first = bisect_left(self.ends, start)
+        last = bisect_right(self.starts, end)
+        merged_length = sum(self.ends[k] - self.starts[k] for k in range(first, last))
+        if first < last:
+            start, end = min(start, self.starts[first]), max(end, self.ends[last - 1])
+        self.starts[first:last] = [start]
+        self.ends[first:last] = [end]
+        return (end - start) - merged_length
+
+    def contains(self, value: int) -> bool:
+        index = bisect_right(self.starts, value) - 1
+        return index >= 0 and value < self.ends[index]
+
+    def missing(self, start: int, end: int) -> List[Tuple[int, int]]:
+        """
+        Sub-ranges of [start, end) not covered by the set.
+        """
+        gaps = []
+        cursor = start
+        index = bisect_right(self.ends, start)
+        while index < len(self.starts) and self.starts[index] < end:
+            if self.starts[index] > cursor:
+                gaps.append((cursor, self.starts[index]))
+            cursor = max(cursor, self.ends[index])
+            index += 1
+        if cursor < end:
+            gaps.append((cursor, end))
+        return gaps
+
+    def remove_before(self, cutoff: int):
+        index = bisect_right(self.ends, cutoff)
+        del self.starts[:index], self.ends[:index]
+        if self.starts and self.starts[0] < cutoff:
+            self.starts[0] = cutoff
+
+    def total(self) -> int:
+        return sum(end - start for start, end in zip(self.starts, self.ends))
+
+    def bounds(self) -> Optional[Tuple[int, int]]:
+        return (self.starts[0], self.ends[-1]) if self.starts else None
+
+    def to_list(self) -> List[List[int]]:
+        return [[start, end] for start, end in zip(self.starts, self.ends)]
+
+
+def timestamps_to_runs(timestamps, timeframe_ms: int) -> List[Tuple[int, int]]:
+    """
+    Groups bar timestamps (epoch ms) into contiguous [start, end) runs.
+    """
+    values = np.unique(np.asarray(timestamps, dtype=np.int64))
+    if not len(values):
+        return []
+    breaks = np.nonzero(np.diff(values) != timeframe_ms)[0]
+    run_starts = np.concatenate(([values[0]], values[breaks + 1]))
+    run_ends = np.concatenate((values[breaks], [values[-1]])) + timeframe_ms
+    return [(int(start), int(end)) for start, end in zip(run_starts, run_ends)]
+
+
+class CoverageIndex:
+    """
+    Bars present in storage plus ranges confirmed empty at the source, for one config.
+    """
+
+    def __init__(self, timeframe_ms: int, intervals=None, empty_intervals=None, bar_count: int = 0):
+        self.timeframe_ms = timeframe_ms
+        self.bars = IntervalSet(intervals)
+        self.empty = IntervalSet(empty_intervals)
+        self.bar_count = int(bar_count)
+
+    def _align(self, start_ms: int, end_ms: int) -> Tuple[int, int]:
+        # بازه به مرز کندل‌ها گرد می‌شود: کندلی که در بازه شروع می‌شود جزو آن است
+        start = -(-int(start_ms) // self.timeframe_ms) * self.timeframe_ms
+        end = -(-int(end_ms) // self.timeframe_ms) * self.timeframe_ms
+        return start, end
+
+    def add_bars(self, timestamps) -> int:
+        added = 0
+        for start, end in timestamps_to_runs(timestamps, self.timeframe_ms):
+            added += self.bars.add(start, end)
+        self.bar_count += added // self.timeframe_ms
+        return added // self.timeframe_ms
+
+    def add_empty(self, start_ms: int, end_ms: int):
+        start, end = self._align(start_ms, end_ms)
+        # فقط بخش‌هایی که واقعاً کندل ندارند خالی علامت می‌خورند
+        for gap_start, gap_end in self.bars.missing(start, end):
+            self.empty.add(gap_start, gap_end)
+
+    def missing_ranges(self, start_ms: int, end_ms: int) -> List[Tuple[int, int]]:
+        """
+        [start, end) ranges of bars in the window that are neither stored nor known to be empty.
+        """
+        start, end = self._align(start_ms, end_ms)
+        gaps = []
+        for gap_start, gap_end in self.bars.missing(start, end):
+            gaps.extend(self.empty.missing(gap_start, gap_end))
+        return gaps
+
+    def report(self, start_ms: int, end_ms: int, limit: int = 100) -> Dict:
+        start, end = self._align(start_ms, end_ms)
+        gaps = self.missing_ranges(start, end)
+        expected = max(0, (end - start) // self.timeframe_ms)
+        missing_bars = sum(gap_end - gap_start for gap_start, gap_end in gaps) // self.timeframe_ms
+        return {
+            'start': start,
+            'end': end,
+            'expected_bars': expected,
+            'missing_bars': missing_bars,
+            'completeness': round(1.0 - missing_bars / expected, 6) if expected else 1.0,
+            'missing_ranges': [[gap_start, gap_end] for gap_start, gap_end in gaps[:limit]],
+            'missing_range_count': len(gaps),
+            'is_complete': not gaps,
+        }
+
+
+# --- ذخیره و به‌روزرسانی افزایشی ---
+
+# آخرین بازه پوشش‌داده‌شده هر کانفیگ در این پروسس؛ به‌روزرسانی‌های مکرر کندل باز بدون کوئری رد می‌شوند
+_recent_runs: Dict = {}
+_recent_lock = threading.Lock()
+
+
+def _load(config, for_update: bool = False):
+    from .models import MarketDataCoverage # Import داخل تابع برای جلوگیری از حلقه
+
+    queryset = MarketDataCoverage.objects.select_for_update() if for_update else MarketDataCoverage.objects
+    row = queryset.filter(config_id=config.id).first()
+    if row is None and for_update:
+        row, _ = MarketDataCoverage.objects.get_or_create(config_id=config.id)
+        row = MarketDataCoverage.objects.select_for_update().get(pk=row.pk)
+    return row
+
+
+def get_coverage_index(config) -> Optional[CoverageIndex]:
+    """
+    Coverage index of a config, or None if it has never been built.
+    """
+    row = _load(config)
+    if row is None:
+        return None
+    return CoverageIndex(timeframe_to_ms(config.timeframe), row.intervals, row.empty_intervals, row.bar_count)
+
+
+def _update(config, apply) -> Optional[CoverageIndex]:
+    with transaction.atomic():
+        row = _load(config, for_update=True)
+        index = CoverageIndex(timeframe_to_ms(config.timeframe), row.intervals, row.empty_intervals, row.bar_count)
+        apply(index)
+        row.intervals = index.bars.to_list()
+        row.empty_intervals = index.empty.to_list()
+        row.bar_count = index.bar_count
+        row.save(update_fields=['intervals', 'empty_intervals', 'bar_count', 'updated_at'])
+    return index
+
+
+def record_bars(config, timestamps) -> int:
+    """
+    Marks stored bars (epoch ms or datetimes) as present; returns the number of newly covered bars.
+    """
+    timestamps = [to_epoch_ms(value) for value in timestamps]
+    if not timestamps:
+        return 0
+    recent = _recent_runs.get(config.id)
+    if recent is not None and all(recent[0] <= value < recent[1] for value in timestamps):
+        return 0
+    added = []
+    index = _update(config, lambda index: added.append(index.add_bars(timestamps)))
+    position = bisect_right(index.bars.starts, max(timestamps)) - 1
+    with _recent_lock:
+        _recent_runs[config.id] = (index.bars.starts[position], index.bars.ends[position])
+    metrics.incr(f'{METRIC_PREFIX}.bars_added', added[0])
+    return added[0]
+
+
+def record_empty_ranges(config, ranges: Iterable[Tuple[int, int]]):
+    """
+    Marks ranges the source confirmed to have no candles (fetched, nothing returned).
+    """
+    ranges = list(ranges)
+    if ranges:
+        _update(config, lambda index: [index.add_empty(start, end) for start, end in ranges])
+
+
+def get_missing_ranges(config, start_ms: int, end_ms: int) -> List[Tuple[int, int]]:
+    """
+    Missing bar ranges of a config in [start_ms, end_ms); the whole window if no index exists.
+    """
+    index = get_coverage_index(config)
+    if index is None:
+        timeframe_ms = timeframe_to_ms(config.timeframe)
+        return CoverageIndex(timeframe_ms).missing_ranges(start_ms, end_ms)
+    return index.missing_ranges(start_ms, end_ms)
+
+
+def get_coverage_report(config, start, end, limit: int = 100) -> Dict:
+    index = get_coverage_index(config) or CoverageIndex(timeframe_to_ms(config.timeframe))
+    report = index.report(to_epoch_ms(start), to_epoch_ms(end), limit=limit)
+    report['indexed'] = index.bar_count > 0 or len(index.bars) > 0
+    bounds = index.bars.bounds()
+    report['first_bar'] = bounds[0] if bounds else None
+    report['last_bar'] = bounds[1] - index.timeframe_ms if bounds else None
+    return report
+
+
+def rebuild_coverage(config, chunk_size: int = 100_000) -> CoverageIndex:
+    """
+    Rebuilds a config's index from the stored candles (one ordered scan), keeping known-empty ranges.
+    """
+    from .models import MarketDataSnapshot # Import داخل تابع برای جلوگیری از حلقه
+
+    timeframe_ms = timeframe_to_ms(config.timeframe)
+    fresh = CoverageIndex(timeframe_ms)
+    batch = []
+    values = (
+        MarketDataSnapshot.objects.filter(config=config).order_by('timestamp')
+        .values_list('timestamp', flat=True).iterator(chunk_size=10000)
+    )
+    for value in values:
+        batch.append(to_epoch_ms(value))
+        if len(batch) >= chunk_size:
+            fresh.add_bars(batch)
+            batch = []
+    fresh.add_bars(batch)
+
+    def replace(index):
+        index.bars, index.bar_count = fresh.bars, fresh.bar_count
+
+    index = _update(config, replace)
+    with _recent_lock:
+        _recent_runs.pop(config.id, None)
+    logger.info(f"Rebuilt coverage index of config {config.id}: {index.bar_count} bars in {len(index.bars)} intervals.")
+    return index
+
+
+def trim_coverage_before(cutoff) -> int:
+    """
+    Drops coverage older than cutoff after retention removed those candles; returns updated rows.
+    """
+    from .models import MarketDataCoverage # Import داخل تابع برای جلوگیری از حلقه
+
+    cutoff_ms = to_epoch_ms(cutoff)
+    updated = 0
+    for row in MarketDataCoverage.objects.select_related('config').iterator():
+        bars, empty = IntervalSet(row.intervals), IntervalSet(row.empty_intervals)
+        bounds = bars.bounds()
+        if (bounds is None or bounds[0] >= cutoff_ms) and not (empty.bounds() and empty.bounds()[0] < cutoff_ms):
+            continue
+        bars.remove_before(cutoff_ms)
+        empty.remove_before(cutoff_ms)
+        row.intervals, row.empty_intervals = bars.to_list(), empty.to_list()
+        row.bar_count = bars.total() // timeframe_to_ms(row.config.timeframe)
+        row.save(update_fields=['intervals', 'empty_intervals', 'bar_count', 'updated_at'])
+        updated += 1
+    clear_recent_runs()
+    return updated
+
+
+def clear_recent_runs():
+    with _recent_lock:
+        _recent_runs.clear()
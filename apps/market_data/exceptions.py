@@ -101,6 +101,15 @@ class OrderBookChecksumError(MarketDataBaseError):
     default_detail = _('Order book checksum mismatch detected.')
     default_code = 'order_book_checksum_error'
 
+class OrderBookSequenceGapError(MarketDataBaseError):
+    """
+    Raised when an order book diff does not continue the sequence of the local book.
+    The local book must be resynchronized from a fresh snapshot.
+    """
+    status_code = 422
+    default_detail = _('Order book sequence gap detected.')
+    default_code = 'order_book_sequence_gap'
+
 class CacheMissError(MarketDataBaseError):
     """
     Raised when requested data is not found in the cache and must be fetched from the database/API.
@@ -6,98 +6,23 @@ from typing import Dict, Any, List, Optional
 from django.utils import timezone
 from datetime import datetime
 from .exceptions import DataProcessingError
+from .normalizers import get_normalizer
 
 logger = logging.getLogger(__name__)
 
 def normalize_data_from_source(raw_data: Dict[str, Any], source_name: str, data_type: str) -> Optional[Dict[str, Any]]:
     """
     Normalizes raw data from different sources (e.g., Binance, Coinbase) into a standard format.
-    This function maps source-specific field names to a common structure based on the data type.
+    Delegates to the normalizer registered for (source, data type) in normalizers.py; returns {}
+    for unsupported pairs and None for malformed payloads.
     """
-    normalized = {}
+    normalizer = get_normalizer(source_name, data_type)
+    if normalizer is None:
+        return {}
     try:
-        if data_type == 'OHLCV':
-            # مثال نرمالایز برای OHLCV از Binance
-            if source_name.upper() == 'BINANCE':
-                # [0] Open Time
-                # [1] Open Price
-                # [2] High Price
-                # [3] Low Price
-                # [4] Close Price
-                # [5] Volume
-                # [6] Close Time
-                # [7] Quote Asset Volume
-                # [8] Number of Trades
-                # [9] Taker Buy Base Asset Volume
-                # [10] Taker Buy Quote Asset Volume
-                # [11] Ignore
-                kline = raw_data['k'] # فرض بر این است که raw_data شامل یک کلید 'k' است که داده kline را دارد
-                normalized = {
-                    'timestamp': int(kline[0]),
-                    'open': Decimal(str(kline[1])),
-                    'high': Decimal(str(kline[2])),
-                    'low': Decimal(str(kline[3])),
-                    'close': Decimal(str(kline[4])),
-                    'volume': Decimal(str(kline[5])),
-                    'close_time': int(kline[6]),
-                    'quote_volume': Decimal(str(kline[7])),
-                    'number_of_trades': int(kline[8]),
-                    'taker_buy_base_asset_volume': Decimal(str(kline[9])),
-                    'taker_buy_quote_asset_volume': Decimal(str(kline[10])),
-                    'additional_data': {} # می‌توانید داده‌های دیگر را در اینجا اضافه کنید
-                }
-            elif source_name.upper() == 'COINBASE':
-                # مثال نرمالایز برای OHLCV از Coinbase (ساختار متفاوت)
-                # فرض بر این است که raw_data ساختار زیر را دارد: {'time': ..., 'low': ..., 'high': ..., 'open': ..., 'close': ..., 'volume': ...}
-                normalized = {
-                    'timestamp': int(raw_data['time']),
-                    'open': Decimal(str(raw_data['open'])),
-                    'high': Decimal(str(raw_data['high'])),
-                    'low': Decimal(str(raw_data['low'])),
-                    'close': Decimal(str(raw_data['close'])),
-                    'volume': Decimal(str(raw_data['volume'])),
-                    'close_time': None, # Coinbase ممکن است close_time جداگانه ندهد
-                    'quote_volume': None,
-                    'number_of_trades': None,
-                    'taker_buy_base_asset_volume': None,
-                    'taker_buy_quote_asset_volume': None,
-                    'additional_data': {}
-                }
-            # ... سایر صرافی‌ها
-
-        elif data_type == 'TICK':
-            # مثال نرمالایز برای TICK از Binance
-            if source_name.upper() == 'BINANCE':
-                # فرض بر این است که raw_data شامل فیلدهای tick است
-                # مثلاً {'p': 'price', 'q': 'quantity', 'T': 'timestamp', 'm': 'maker', 's': 'symbol'}
-                normalized = {
-                    'timestamp': int(raw_data['T']),
-                    'price': Decimal(str(raw_data['p'])),
-                    'quantity': Decimal(str(raw_data['q'])),
-                    'side': 'BUY' if raw_data['m'] else 'SELL', # maker sell = taker buy
-                    'trade_id': raw_data.get('t', None)
-                }
-            # ... سایر صرافی‌ها
-
-        elif data_type == 'ORDER_BOOK':
-            # مثال نرمالایز برای ORDER BOOK از Binance
-            if source_name.upper() == 'BINANCE':
-                # فرض بر این است که raw_data شامل bids و asks است
-                # مثلاً {'bids': [[price1, qty1], [price2, qty2]], 'asks': [...], 'T': 'timestamp', 'U': 'update_id', 'u': 'final_update_id'}
-                normalized = {
-                    'timestamp': int(raw_data['T']),
-                    'bids': [[Decimal(str(bid[0])), Decimal(str(bid[1]))] for bid in raw_data['bids']],
-                    'asks': [[Decimal(str(ask[0])), Decimal(str(ask[1]))] for ask in raw_data['asks']],
-                    'sequence': raw_data.get('u'), # final update id
-                    'checksum': raw_data.get('checksum') # ممکن است وجود نداشته باشد
-                }
-            # ... سایر صرافی‌ها
-
-        # اضافه کردن منطق نرمالایز برای سایر data_typeها (INDEX, FUNDING_RATE, etc.)
-
-        return normalized
-
-    except (KeyError, ValueError, TypeError) as e:
+        return normalizer.normalize(raw_data) or {}
+
+    except (KeyError, ValueError, TypeError, AttributeError, IndexError) as e:
         logger.error(f"Error normalizing data from {source_name} for {data_type}: {str(e)}. Raw data: {raw_data}")
         return None
 
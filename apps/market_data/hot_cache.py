@@ -0,0 +1,422 @@
+# apps/market_data/hot_cache.py
+
+"""
+Hot market state: latest tick, candle and top-of-book of every config.
+
+State lives in a shared backend (Redis hashes, or process memory for a single worker) and
+is fronted by a small in-process LRU with a short TTL, so latest-price reads never touch
+Postgres. Writes are coalesced: inside an event loop all updates of one loop iteration go
+out in a single pipeline; sync callers can group writes with batch(). The MarketDataCache
+table only receives periodic checkpoints (checkpoint_market_state_task).
+"""
+
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from django.conf import settings
+
+from apps.core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+METRIC_PREFIX = 'market_data.hot_cache'
+KEY_PREFIX = 'market_data:state'
+
+KIND_TICK = 'tick'
+KIND_CANDLE = 'candle'
+KIND_BOOK = 'book'
+DATA_TYPE_KINDS = {
+    'OHLCV': KIND_CANDLE,
+    'TICK': KIND_TICK,
+    'TRADES': KIND_TICK,
+    'ORDER_BOOK': KIND_BOOK,
+}
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (tuple, set)):
+        return list(value)
+    return str(value)
+
+
+def dumps(value) -> str:
+    return json.dumps(value, default=_json_default, separators=(',', ':'))
+
+
+def price_alias(symbol: str, source: Optional[str] = None) -> str:
+    if source:
+        return f"price:{source.upper()}:{symbol.upper()}"
+    return f"price:{symbol.upper()}"
+
+
+def candle_alias(symbol: str, timeframe: str) -> str:
+    return f"candle:{symbol.upper()}:{timeframe}"
+
+
+def book_alias(symbol: str) -> str:
+    return f"book:{symbol.upper()}"
+
+
+def extract_price(kind: str, data: Dict) -> Optional[float]:
+    """
+    Last traded/mark price implied by one update (tick price, candle close, book microprice/mid).
+    """
+    try:
+        if kind == KIND_TICK:
+            return float(data['price'])
+        if kind == KIND_CANDLE:
+            return float(data.get('close', data.get('close_price')))
+        if kind == KIND_BOOK:
+            if data.get('microprice') is not None:
+                return float(data['microprice'])
+            bid, ask = data.get('best_bid'), data.get('best_ask')
+            if bid is None and data.get('bids') and data.get('asks'):
+                # دفتر کامل (سطوح به ترتیب بهترین اول)
+                bid, ask = data['bids'][0], data['asks'][0]
+            if bid and ask:
+                bid = bid[0] if isinstance(bid, (list, tuple)) else bid
+                ask = ask[0] if isinstance(ask, (list, tuple)) else ask
+                return (float(bid) + float(ask)) / 2.0
+    except (KeyError, TypeError, ValueError):
+        return None
+    return None
+
+
+# --- بک‌اندهای ذخیره وضعیت ---
+
+class InMemoryMarketStateBackend:
+    """
+    Keeps market state in process memory (single worker, tests).
+    """
+
+    def __init__(self):
+        self._states: Dict[str, Dict[str, str]] = {}
+        self._aliases: Dict[str, str] = {}
+        self._dirty: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def write_many(self, states: Dict[str, Dict[str, str]], aliases: Dict[str, str]):
+        with self._lock:
+            for config_id, fields in states.items():
+                self._states.setdefault(config_id, {}).update(fields)
+            self._aliases.update(aliases)
+            self._dirty.update(states)
+
+    def read(self, config_id: str) -> Dict[str, str]:
+        with self._lock:
+            return dict(self._states.get(config_id, {}))
+
+    def resolve(self, alias: str) -> Optional[str]:
+        return self._aliases.get(alias)
+
+    def pop_dirty(self) -> List[str]:
+        with self._lock:
+            dirty, self._dirty = list(self._dirty), set()
+            return dirty
+
+    def clear(self):
+        with self._lock:
+            self._states.clear()
+            self._aliases.clear()
+            self._dirty.clear()
+
+
+class RedisMarketStateBackend:
+    """
+    One Redis hash per config plus an alias hash (symbol -> config id); every flush is one pipeline.
+    """
+
+    def __init__(self, client=None):
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            import redis # Import داخل تابع؛ redis فقط برای این بک‌اند لازم است
+            self._client = redis.Redis(
+                host=getattr(settings, 'REDIS_HOST', 'localhost'),
+                port=getattr(settings, 'REDIS_PORT', 6379),
+                db=getattr(settings, 'REDIS_DB', 0),
+                decode_responses=True,
+            )
+        return self._client
+
+    @staticmethod
+    def _key(config_id: str) -> str:
+        return f"{KEY_PREFIX}:{config_id}"
+
+    def write_many(self, states: Dict[str, Dict[str, str]], aliases: Dict[str, str]):
+        pipe = self.client.pipeline(transaction=False)
+        for config_id, fields in states.items():
+            pipe.hset(self._key(config_id), mapping=fields)
+        if aliases:
+            pipe.hset(f"{KEY_PREFIX}:aliases", mapping=aliases)
+        if states:
+            pipe.sadd(f"{KEY_PREFIX}:dirty", *states.keys())
+        pipe.execute()
+
+    def read(self, config_id: str) -> Dict[str, str]:
+        return self.client.hgetall(self._key(config_id)) or {}
+
+    def resolve(self, alias: str) -> Optional[str]:
+        return self.client.hget(f"{KEY_PREFIX}:aliases", alias)
+
+    def pop_dirty(self) -> List[str]:
+        pipe = self.client.pipeline(transaction=True)
+        pipe.smembers(f"{KEY_PREFIX}:dirty")
+        pipe.delete(f"{KEY_PREFIX}:dirty")
+        members, _ = pipe.execute()
+        return list(members or [])
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=f"{KEY_PREFIX}:*", count=500))
+        if keys:
+            self.client.delete(*keys)
+
+
+def get_market_state_backend():
+    backend = getattr(settings, 'MARKET_DATA_HOT_CACHE_BACKEND', 'redis')
+    if backend == 'memory':
+        return InMemoryMarketStateBackend()
+    return RedisMarketStateBackend()
+
+
+# --- کش داغ ---
+
+class HotMarketStateCache:
+    """
+    Latest per-config market state with coalesced pipelined writes and a read-through local LRU.
+    """
+
+    def __init__(self, backend=None, local_ttl_ms: Optional[int] = None, max_local_entries: Optional[int] = None, clock=time.monotonic):
+        self._backend = backend
+        self._local_ttl_ms = local_ttl_ms
+        self._max_local_entries = max_local_entries
+        self._clock = clock
+        self._local: OrderedDict = OrderedDict() # key -> (expires_at, value)
+        self._pending: Dict[str, Dict[str, str]] = {}
+        self._pending_aliases: Dict[str, str] = {}
+        self._flush_scheduled = False
+        self._batch_depth = 0
+        self._lock = threading.RLock()
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = get_market_state_backend()
+        return self._backend
+
+    @property
+    def local_ttl_seconds(self) -> float:
+        ttl_ms = self._local_ttl_ms if self._local_ttl_ms is not None else getattr(settings, 'MARKET_DATA_HOT_CACHE_LOCAL_TTL_MS', 250)
+        return ttl_ms / 1000.0
+
+    @property
+    def max_local_entries(self) -> int:
+        return self._max_local_entries or getattr(settings, 'MARKET_DATA_HOT_CACHE_LOCAL_MAX_ENTRIES', 10000)
+
+    # --- نوشتن ---
+    def update(self, config, data_type: str, data: Dict):
+        """
+        Records the latest update of a config. The local view is updated immediately;
+        the shared backend is written once per event-loop iteration (or batch).
+        """
+        kind = DATA_TYPE_KINDS.get(data_type, data_type.lower())
+        config_id = str(config.id)
+        now_ms = int(time.time() * 1000)
+        fields = {kind: dumps(data), f'{kind}_at': str(now_ms)}
+        price = extract_price(kind, data)
+        symbol = config.instrument.symbol
+        aliases = {}
+        if price is not None:
+            from .streams import get_source_code # Import داخل تابع برای جلوگیری از حلقه
+
+            fields['price'] = repr(price)
+            fields['price_at'] = str(now_ms)
+            aliases[price_alias(symbol)] = config_id
+            aliases[price_alias(symbol, get_source_code(config.data_source))] = config_id
+        if kind == KIND_CANDLE:
+            aliases[candle_alias(symbol, config.timeframe)] = config_id
+        elif kind == KIND_BOOK:
+            aliases[book_alias(symbol)] = config_id
+
+        with self._lock:
+            self._pending.setdefault(config_id, {}).update(fields)
+            self._pending_aliases.update(aliases)
+            # نمای محلی همین پروسس بلافاصله تازه می‌شود
+            state = self._local_get(('state', config_id))
+            if state is not None:
+                state.update(fields)
+            for alias in aliases:
+                self._local_set(('alias', alias), config_id)
+        metrics.incr(f'{METRIC_PREFIX}.updates')
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._batch_depth:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is None:
+            self.flush()
+            return
+        with self._lock:
+            if self._flush_scheduled:
+                return
+            self._flush_scheduled = True
+        # همه به‌روزرسانی‌های همین دور حلقه رویداد در یک pipeline نوشته می‌شوند
+        loop.call_soon(self.flush)
+
+    @contextmanager
+    def batch(self):
+        """
+        Groups the writes of a sync code block into one pipeline.
+        """
+        with self._lock:
+            self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._batch_depth -= 1
+                depth = self._batch_depth
+            if depth == 0:
+                self.flush()
+
+    def flush(self) -> int:
+        with self._lock:
+            states, aliases = self._pending, self._pending_aliases
+            self._pending, self._pending_aliases = {}, {}
+            self._flush_scheduled = False
+        if not states and not aliases:
+            return 0
+        try:
+            self.backend.write_many(states, aliases)
+        except Exception as e:
+            metrics.incr(f'{METRIC_PREFIX}.flush_errors')
+            logger.error(f"Failed to flush hot market state ({len(states)} configs): {e}")
+            return 0
+        metrics.incr(f'{METRIC_PREFIX}.flushes')
+        return len(states)
+
+    # --- LRU محلی ---
+    def _local_get(self, key):
+        entry = self._local.get(key)
+        if entry is None:
+            return None
+        if entry[0] < self._clock():
+            self._local.pop(key, None)
+            return None
+        self._local.move_to_end(key)
+        return entry[1]
+
+    def _local_set(self, key, value):
+        self._local[key] = (self._clock() + self.local_ttl_seconds, value)
+        self._local.move_to_end(key)
+        while len(self._local) > self.max_local_entries:
+            self._local.popitem(last=False)
+
+    # --- خواندن ---
+    def get_state(self, config_id) -> Dict[str, str]:
+        key = ('state', str(config_id))
+        with self._lock:
+            state = self._local_get(key)
+            if state is not None:
+                metrics.incr(f'{METRIC_PREFIX}.hits.local')
+                return state
+        state = self.backend.read(str(config_id))
+        with self._lock:
+            # تغییرات هنوز flush نشده این پروسس روی مقدار بک‌اند اعمال می‌شوند
+            state.update(self._pending.get(str(config_id), {}))
+            self._local_set(key, state)
+        metrics.incr(f'{METRIC_PREFIX}.hits.backend' if state else f'{METRIC_PREFIX}.misses')
+        return state
+
+    def resolve(self, alias: str) -> Optional[str]:
+        key = ('alias', alias)
+        with self._lock:
+            config_id = self._local_get(key)
+            if config_id is not None:
+                return config_id
+            config_id = self._pending_aliases.get(alias)
+        if config_id is None:
+            config_id = self.backend.resolve(alias)
+        if config_id is not None:
+            with self._lock:
+                self._local_set(key, config_id)
+        return config_id
+
+    def get(self, config_id, kind: str) -> Optional[Dict]:
+        raw = self.get_state(config_id).get(kind)
+        return json.loads(raw) if raw else None
+
+    def get_latest_price(self, symbol: str, source: Optional[str] = None,
+                         max_age_ms: Optional[int] = None) -> Optional[Tuple[float, int]]:
+        """
+        (price, updated_at epoch ms) of a symbol (on one source, or the most recently updated
+        config of any source), or None if unknown or older than max_age_ms.
+        """
+        config_id = self.resolve(price_alias(symbol, source))
+        if config_id is None:
+            return None
+        state = self.get_state(config_id)
+        if 'price' not in state:
+            return None
+        price, price_at = float(state['price']), int(state.get('price_at', 0))
+        if max_age_ms is not None and int(time.time() * 1000) - price_at > max_age_ms:
+            return None
+        return price, price_at
+
+    def get_latest_candle(self, symbol: str, timeframe: str) -> Optional[Dict]:
+        config_id = self.resolve(candle_alias(symbol, timeframe))
+        return self.get(config_id, KIND_CANDLE) if config_id is not None else None
+
+    def get_latest_book(self, symbol: str) -> Optional[Dict]:
+        config_id = self.resolve(book_alias(symbol))
+        return self.get(config_id, KIND_BOOK) if config_id is not None else None
+
+    # --- checkpoint ---
+    def pop_dirty(self) -> List[str]:
+        self.flush()
+        return self.backend.pop_dirty()
+
+    def snapshot_for_checkpoint(self, config_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Decoded state of each config, in the shape stored in MarketDataCache.latest_snapshot.
+        """
+        snapshots = {}
+        for config_id in config_ids:
+            state = self.backend.read(str(config_id))
+            if not state:
+                continue
+            snapshot = {kind: json.loads(state[kind]) for kind in (KIND_TICK, KIND_CANDLE, KIND_BOOK) if state.get(kind)}
+            if 'price' in state:
+                snapshot['price'] = float(state['price'])
+                snapshot['price_at'] = int(state.get('price_at', 0))
+            snapshots[str(config_id)] = snapshot
+        return snapshots
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+            self._pending.clear()
+            self._pending_aliases.clear()
+        self.backend.clear()
+
+
+# کش سراسری در سطح پروسس (بک‌اند از settings.MARKET_DATA_HOT_CACHE_BACKEND)
+hot_market_cache = HotMarketStateCache()
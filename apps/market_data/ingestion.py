@@ -0,0 +1,334 @@
+# apps/market_data/ingestion.py
+
+import atexit
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from django.db import close_old_connections, transaction
+
+from apps.core.metrics import metrics
+from .models import MarketDataConfig, MarketDataTick
+
+logger = logging.getLogger(__name__)
+
+# تنظیمات پیش‌فرض بچ‌کردن تیک‌ها؛ هر DataSource می‌تواند در config['tick_batching'] آن‌ها را بازنویسی کند
+DEFAULT_TICK_BATCHING = {
+    'enabled': False,
+    'max_batch_size': 500,      # حداکثر تعداد تیک در هر flush
+    'max_latency_ms': 250,      # حداکثر زمان ماندن یک تیک در بافر
+    'max_pending_rows': 10000,  # سقف بافر (شامل تیک‌های برگشتی از flush ناموفق)
+}
+
+# پس از این تعداد flush ناموفق پیاپی، بچ برای جدا کردن ردیف‌های نامعتبر تقسیم و فقط همان‌ها کنار گذاشته می‌شوند
+MAX_FLUSH_RETRIES = 5
+
+METRIC_PREFIX = 'market_data.tick_batch'
+
+
+def get_tick_batching_settings(data_source) -> Dict[str, Any]:
+    """
+    Returns the effective tick batching settings for a DataSource
+    (defaults merged with data_source.config['tick_batching']).
+    """
+    merged = dict(DEFAULT_TICK_BATCHING)
+    source_config = getattr(data_source, 'config', None) or {}
+    overrides = source_config.get('tick_batching') or {}
+    if isinstance(overrides, dict):
+        merged.update(overrides)
+    merged['max_batch_size'] = max(1, int(merged['max_batch_size']))
+    merged['max_latency_ms'] = max(1, int(merged['max_latency_ms']))
+    merged['max_pending_rows'] = max(merged['max_batch_size'], int(merged['max_pending_rows']))
+    return merged
+
+
+class TickBatcher:
+    """
+    Collects normalized ticks for a single MarketDataConfig and writes them
+    with one bulk_create per flush (size or time threshold).
+    """
+
+    def __init__(self, config: MarketDataConfig, max_batch_size: int, max_latency_ms: int,
+                 max_pending_rows: Optional[int] = None):
+        self.config = config
+        self.max_batch_size = max_batch_size
+        self.max_latency_ms = max_latency_ms
+        self.max_pending_rows = max(max_batch_size, max_pending_rows or DEFAULT_TICK_BATCHING['max_pending_rows'])
+        self._failed_flushes = 0
+        self._rows: List[Dict[str, Any]] = []
+        self._first_added_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def add(self, row: Dict[str, Any]) -> int:
+        """
+        Adds a tick row to the buffer. Flushes immediately if a threshold is reached.
+        Returns the number of ticks written (0 if nothing was flushed).
+        """
+        with self._lock:
+            if self._first_added_at is None:
+                self._first_added_at = time.monotonic()
+            self._rows.append(row)
+            if len(self._rows) < self.max_batch_size and not self._is_due():
+                return 0
+            rows = self._drain()
+        return self._write(rows)
+
+    def flush_if_due(self) -> int:
+        """
+        Flushes the buffer if the oldest tick has waited longer than max_latency_ms.
+        """
+        with self._lock:
+            if not self._rows or not self._is_due():
+                return 0
+            rows = self._drain()
+        return self._write(rows)
+
+    def flush(self) -> int:
+        """
+        Unconditionally flushes whatever is buffered.
+        """
+        with self._lock:
+            rows = self._drain()
+        return self._write(rows)
+
+    def _is_due(self) -> bool:
+        if self._first_added_at is None:
+            return False
+        return (time.monotonic() - self._first_added_at) * 1000.0 >= self.max_latency_ms
+
+    def _drain(self) -> List[Dict[str, Any]]:
+        rows, self._rows = self._rows, []
+        self._first_added_at = None
+        return rows
+
+    def _write(self, rows: List[Dict[str, Any]]) -> int:
+        if not rows:
+            return 0
+
+        # حذف تیک‌های تکراری داخل همین بچ (بر اساس trade_id)؛ تکراری‌های قبلی توسط constraint پایگاه داده نادیده گرفته می‌شوند
+        unique_rows = []
+        seen_trade_ids = set()
+        for row in rows:
+            trade_id = row.get('trade_id')
+            if trade_id is not None:
+                if trade_id in seen_trade_ids:
+                    continue
+                seen_trade_ids.add(trade_id)
+            unique_rows.append(row)
+
+        duplicates = len(rows) - len(unique_rows)
+        if duplicates:
+            metrics.incr(f'{METRIC_PREFIX}.duplicates_dropped', duplicates)
+
+        start = time.perf_counter()
+        try:
+            self._insert(unique_rows)
+        except Exception as e:
+            metrics.incr(f'{METRIC_PREFIX}.flush_errors')
+            logger.error(f"Failed to flush {len(unique_rows)} ticks for config {self.config.id}: {str(e)}")
+            return self._requeue(unique_rows)
+        self._failed_flushes = 0
+
+        latency_ms = (time.perf_counter() - start) * 1000.0
+        metrics.observe(f'{METRIC_PREFIX}.flush_latency_ms', latency_ms)
+        logger.debug(f"Flushed {len(unique_rows)} ticks for config {self.config.id} in {latency_ms:.2f} ms.")
+        self._on_written(unique_rows)
+        return len(unique_rows)
+
+    def _insert(self, rows: List[Dict[str, Any]]):
+        with transaction.atomic():
+            MarketDataTick.objects.bulk_create(
+                [MarketDataTick(config=self.config, **row) for row in rows],
+                batch_size=self.max_batch_size,
+                ignore_conflicts=True,
+            )
+
+    def _on_written(self, rows: List[Dict[str, Any]]):
+        metrics.observe(f'{METRIC_PREFIX}.size', len(rows))
+        metrics.incr(f'{METRIC_PREFIX}.flushes')
+        metrics.incr(f'{METRIC_PREFIX}.ticks_written', len(rows))
+        self._emit_batch_event(rows)
+
+    def _bisect_insert(self, rows: List[Dict[str, Any]]):
+        """
+        Inserts rows, splitting a failing batch in halves until the rows that fail on their own
+        are isolated. Returns (written rows, failed rows).
+        """
+        try:
+            self._insert(rows)
+            return rows, []
+        except Exception as e:
+            if len(rows) == 1:
+                logger.warning(f"Tick {rows[0].get('trade_id')} for config {self.config.id} cannot be written: {str(e)}")
+                return [], rows
+        middle = len(rows) // 2
+        written_head, failed_head = self._bisect_insert(rows[:middle])
+        written_tail, failed_tail = self._bisect_insert(rows[middle:])
+        return written_head + written_tail, failed_head + failed_tail
+
+    def _requeue(self, rows: List[Dict[str, Any]]) -> int:
+        """
+        Puts the rows of a failed flush back at the head of the buffer (bounded by max_pending_rows);
+        they are retried on the next flush. After MAX_FLUSH_RETRIES failed flushes in a row the batch
+        is split to isolate the rows that cannot be written; only those, and rows that do not fit the
+        buffer, are dropped and counted. Returns the number of rows written while isolating.
+        """
+        with self._lock:
+            self._failed_flushes += 1
+            isolate = self._failed_flushes > MAX_FLUSH_RETRIES
+            kept = []
+            if isolate:
+                self._failed_flushes = 0
+            else:
+                room = max(0, self.max_pending_rows - len(self._rows))
+                # جدیدترین تیک‌ها نگه داشته می‌شوند
+                kept = rows[-room:] if room else []
+                self._rows = kept + self._rows
+                if kept and self._first_added_at is None:
+                    self._first_added_at = time.monotonic()
+
+        written = []
+        if isolate:
+            # فقط ردیف‌هایی که به تنهایی هم نوشته نمی‌شوند کنار گذاشته می‌شوند
+            written, failed = self._bisect_insert(rows)
+            if written:
+                self._on_written(written)
+            dropped = len(failed)
+        else:
+            if kept:
+                metrics.incr(f'{METRIC_PREFIX}.ticks_requeued', len(kept))
+            dropped = len(rows) - len(kept)
+        if dropped:
+            metrics.incr(f'{METRIC_PREFIX}.ticks_dropped', dropped)
+            logger.error(f"Dropped {dropped} unwritten ticks for config {self.config.id}.")
+        return len(written)
+
+    def _emit_batch_event(self, rows: List[Dict[str, Any]]):
+        """
+        Sends one downstream event per flush (instead of one task per tick)
+        and refreshes the config cache with the most recent tick.
+        """
+        from .services import MarketDataService # Import داخل تابع برای جلوگیری از حلقه
+        from .tasks import process_tick_batch_task
+
+        first_ts = min(row['timestamp'] for row in rows)
+        last_row = max(rows, key=lambda row: row['timestamp'])
+        try:
+            process_tick_batch_task.delay(
+                self.config.id,
+                first_ts.isoformat(),
+                last_row['timestamp'].isoformat(),
+                len(rows),
+            )
+        except Exception as e:
+            logger.error(f"Failed to enqueue tick batch event for config {self.config.id}: {str(e)}")
+
+        MarketDataService.update_cache_for_config(
+            self.config,
+            {
+                'timestamp': last_row['timestamp'].isoformat(),
+                'price': str(last_row['price']),
+                'quantity': str(last_row['quantity']),
+                'side': last_row['side'],
+                'trade_id': last_row.get('trade_id'),
+            },
+            data_type='TICK',
+        )
+
+
+class TickIngestionBuffer:
+    """
+    Process-wide registry of TickBatchers (one per MarketDataConfig) with a
+    background thread that flushes idle buffers once their latency budget expires.
+    """
+
+    def __init__(self):
+        self._batchers: Dict[Any, TickBatcher] = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+
+    def submit(self, config: MarketDataConfig, row: Dict[str, Any], batching_settings: Optional[Dict[str, Any]] = None) -> int:
+        """
+        Buffers a normalized tick row for its config. Returns the number of ticks flushed by this call.
+        """
+        batcher = self._get_batcher(config, batching_settings)
+        self._ensure_flusher()
+        return batcher.add(row)
+
+    def flush_all(self) -> int:
+        """
+        Flushes every buffered config. Returns the total number of ticks written.
+        """
+        with self._lock:
+            batchers = list(self._batchers.values())
+        return sum(batcher.flush() for batcher in batchers)
+
+    def flush_due(self) -> int:
+        with self._lock:
+            batchers = list(self._batchers.values())
+        return sum(batcher.flush_if_due() for batcher in batchers)
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return sum(len(batcher) for batcher in self._batchers.values())
+
+    def stop(self):
+        """
+        Stops the background flusher and writes out any remaining ticks.
+        """
+        self._stop_event.set()
+        if self._flusher and self._flusher.is_alive():
+            self._flusher.join(timeout=5)
+        self._flusher = None
+        self.flush_all()
+
+    def _get_batcher(self, config: MarketDataConfig, batching_settings: Optional[Dict[str, Any]]) -> TickBatcher:
+        batcher = self._batchers.get(config.id)
+        if batcher is not None:
+            return batcher
+        with self._lock:
+            batcher = self._batchers.get(config.id)
+            if batcher is None:
+                batching_settings = batching_settings or get_tick_batching_settings(config.data_source)
+                batcher = TickBatcher(
+                    config,
+                    max_batch_size=batching_settings['max_batch_size'],
+                    max_latency_ms=batching_settings['max_latency_ms'],
+                    max_pending_rows=batching_settings.get('max_pending_rows'),
+                )
+                self._batchers[config.id] = batcher
+        return batcher
+
+    def _ensure_flusher(self):
+        if self._flusher is not None and self._flusher.is_alive():
+            return
+        with self._lock:
+            if self._flusher is not None and self._flusher.is_alive():
+                return
+            self._stop_event.clear()
+            self._flusher = threading.Thread(target=self._run_flusher, name='tick-ingestion-flusher', daemon=True)
+            self._flusher.start()
+
+    def _run_flusher(self):
+        while not self._stop_event.is_set():
+            with self._lock:
+                latencies = [batcher.max_latency_ms for batcher in self._batchers.values()]
+            # بیدار شدن با نصف کمترین بودجه تاخیر تا هیچ تیکی بیش از حد در بافر نماند
+            interval = (min(latencies) / 2000.0) if latencies else 0.1
+            self._stop_event.wait(max(0.005, interval))
+            try:
+                self.flush_due()
+            except Exception as e:
+                logger.error(f"Error in tick ingestion flusher: {str(e)}")
+            finally:
+                close_old_connections()
+
+
+# بافر سراسری در سطح پروسس
+tick_ingestion_buffer = TickIngestionBuffer()
+atexit.register(tick_ingestion_buffer.flush_all)
@@ -0,0 +1,153 @@
+# apps/market_data/management/commands/benchmark_normalizers.py
+
+import json
+import time
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from apps.core.metrics import metrics
+from apps.market_data.normalizers import get_normalizer, loads, orjson
+
+# پیام‌های ضبط‌شده از استریم/REST هر صرافی (فریم خام، همان‌طور که از سوکت می‌رسد)
+RECORDED_PAYLOADS = {
+    ('BINANCE', 'OHLCV'): (
+        '{"e":"kline","E":1700000012345,"s":"BTCUSDT","k":{"t":1700000000000,"T":1700000059999,'
+        '"s":"BTCUSDT","i":"1m","f":3262850001,"L":3262850480,"o":"37251.01000000","c":"37260.55000000",'
+        '"h":"37264.00000000","l":"37250.00000000","v":"18.52417000","n":480,"x":false,'
+        '"q":"690145.85284460","V":"9.87112000","Q":"367779.26930120","B":"0"}}'
+    ),
+    ('BINANCE', 'TICK'): (
+        '{"e":"trade","E":1700000012345,"s":"BTCUSDT","t":3262850480,"p":"37260.55000000",'
+        '"q":"0.00120000","b":22897151531,"a":22897151510,"T":1700000012344,"m":true,"M":true}'
+    ),
+    ('NOBITEX', 'OHLCV'): (
+        '{"time":1700000000,"open":"1983500000","high":"1984990000","low":"1983000000",'
+        '"close":"1984100000","volume":"0.412345"}'
+    ),
+    ('NOBITEX', 'TICK'): '{"time":1700000012344,"price":"1984100000","volume":"0.004512","type":"buy"}',
+    ('LBANK', 'OHLCV'): (
+        '{"kbar":{"a":76412.7641,"c":37260.55,"t":"2023-11-14T22:13:00.000","v":2.0507,"h":37264.0,'
+        '"slot":"1min","l":37250.0,"n":41,"o":37251.01},"type":"kbar","pair":"btc_usdt",'
+        '"SERVER":"V2","TS":"2023-11-14T22:13:12.345"}'
+    ),
+    ('LBANK', 'TICK'): (
+        '{"trade":{"volume":0.0124,"amount":462.0308,"price":37260.55,"direction":"sell",'
+        '"TS":"2023-11-14T22:13:12.344"},"type":"trade","pair":"btc_usdt","SERVER":"V2",'
+        '"TS":"2023-11-14T22:13:12.345"}'
+    ),
+}
+
+
+def legacy_normalize(raw_data, source_name, data_type):
+    """
+    Baseline: the previous per-message string branching with Decimal(str()) conversions.
+    """
+    if data_type == 'OHLCV':
+        if source_name.upper() == 'BINANCE':
+            kline = raw_data['k']
+            return {
+                'timestamp': int(kline['t']),
+                'open': Decimal(str(kline['o'])),
+                'high': Decimal(str(kline['h'])),
+                'low': Decimal(str(kline['l'])),
+                'close': Decimal(str(kline['c'])),
+                'volume': Decimal(str(kline['v'])),
+                'close_time': int(kline['T']),
+                'quote_volume': Decimal(str(kline['q'])),
+                'number_of_trades': int(kline['n']),
+                'taker_buy_base_asset_volume': Decimal(str(kline['V'])),
+                'taker_buy_quote_asset_volume': Decimal(str(kline['Q'])),
+                'additional_data': {},
+            }
+        elif source_name.upper() == 'NOBITEX':
+            return {
+                'timestamp': int(raw_data['time']) * 1000,
+                'open': Decimal(str(raw_data['open'])),
+                'high': Decimal(str(raw_data['high'])),
+                'low': Decimal(str(raw_data['low'])),
+                'close': Decimal(str(raw_data['close'])),
+                'volume': Decimal(str(raw_data['volume'])),
+            }
+        elif source_name.upper() == 'LBANK':
+            kbar = raw_data['kbar']
+            return {
+                'timestamp': kbar['t'],
+                'open': Decimal(str(kbar['o'])),
+                'high': Decimal(str(kbar['h'])),
+                'low': Decimal(str(kbar['l'])),
+                'close': Decimal(str(kbar['c'])),
+                'volume': Decimal(str(kbar['v'])),
+            }
+    elif data_type == 'TICK':
+        if source_name.upper() == 'BINANCE':
+            return {
+                'timestamp': int(raw_data['T']),
+                'price': Decimal(str(raw_data['p'])),
+                'quantity': Decimal(str(raw_data['q'])),
+                'side': 'SELL' if raw_data['m'] else 'BUY',
+                'trade_id': raw_data.get('t', None),
+            }
+        elif source_name.upper() == 'NOBITEX':
+            return {
+                'timestamp': int(raw_data['time']),
+                'price': Decimal(str(raw_data['price'])),
+                'quantity': Decimal(str(raw_data['volume'])),
+                'side': raw_data['type'].upper(),
+            }
+        elif source_name.upper() == 'LBANK':
+            trade = raw_data['trade']
+            return {
+                'timestamp': trade['TS'],
+                'price': Decimal(str(trade['price'])),
+                'quantity': Decimal(str(trade['volume'])),
+                'side': trade['direction'].upper(),
+            }
+    return raw_data
+
+
+def _rate(function, count: int, repeat: int) -> float:
+    best = None
+    for _ in range(max(repeat, 1)):
+        started = time.perf_counter()
+        for _ in range(count):
+            function()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return count / best
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the registered message normalizers against the legacy normalize functions (msgs/second).'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--messages',
+            type=int,
+            default=100_000,
+            help='Messages per timed run (default: 100000).',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=3,
+            help='Number of timed runs; the best one is reported.',
+        )
+
+    def handle(self, *args, **options):
+        count, repeat = options['messages'], options['repeat']
+        self.stdout.write(f"JSON parser: {'orjson' if orjson is not None else 'json'}; {count:,} messages per run.")
+
+        for (code, data_type), raw in RECORDED_PAYLOADS.items():
+            normalizer = get_normalizer(code, data_type)
+            frame = raw.encode()
+            legacy = _rate(lambda: legacy_normalize(json.loads(frame), code, data_type), count, repeat)
+            exact = _rate(lambda: normalizer.normalize(loads(frame)), count, repeat)
+            decoded = _rate(lambda: normalizer.decode(loads(frame)), count, repeat)
+
+            label = f"{code.lower()}.{data_type.lower()}"
+            metrics.gauge(f'market_data.normalizers.benchmark.{label}.msgs_per_second', decoded)
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"{code}/{data_type}: legacy {legacy:,.0f} msgs/s | normalize (Decimal) {exact:,.0f} | "
+                    f"decode (fixed-point) {decoded:,.0f} ({decoded / legacy:.1f}x)"
+                )
+            )
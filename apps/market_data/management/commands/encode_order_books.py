@@ -0,0 +1,86 @@
+# apps/market_data/management/commands/encode_order_books.py
+
+import json
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from apps.market_data.models import MarketDataConfig, MarketDataOrderBook
+from apps.market_data.order_book_codec import encode_for_config
+
+
+def _best_first(levels, descending: bool):
+    return sorted(((float(price), float(qty)) for price, qty in (levels or [])), key=lambda level: level[0], reverse=descending)
+
+
+class Command(BaseCommand):
+    help = 'Backfills MarketDataOrderBook rows to the binary order book encoding (JSON bids/asks -> encoded_book).'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--config-id',
+            action='append',
+            dest='config_ids',
+            help='MarketDataConfig id to backfill (repeatable). Default: every config with use_binary_order_book.',
+        )
+        parser.add_argument(
+            '--enable',
+            action='store_true',
+            help='Also set use_binary_order_book on the selected configs.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Rows encoded and updated per transaction (default: 1000).',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Encode and report the size reduction without writing.',
+        )
+
+    def handle(self, *args, **options):
+        configs = MarketDataConfig.objects.filter(data_type='ORDER_BOOK').select_related('data_source', 'instrument')
+        if options['config_ids']:
+            configs = configs.filter(id__in=options['config_ids'])
+        elif not options['enable']:
+            configs = configs.filter(use_binary_order_book=True)
+        configs = list(configs)
+        if not configs:
+            raise CommandError('No order book configs selected.')
+
+        batch_size = max(options['batch_size'], 1)
+        for config in configs:
+            if options['enable'] and not options['dry_run'] and not config.use_binary_order_book:
+                config.use_binary_order_book = True
+                config.save(update_fields=['use_binary_order_book'])
+
+            rows = converted = json_bytes = binary_bytes = 0
+            last_pk = None
+            while True:
+                queryset = MarketDataOrderBook.objects.filter(config=config, encoded_book__isnull=True).order_by('pk')
+                if last_pk is not None:
+                    queryset = queryset.filter(pk__gt=last_pk)
+                batch = list(queryset.only('pk', 'timestamp', 'bids', 'asks', 'sequence')[:batch_size])
+                if not batch:
+                    break
+                last_pk = batch[-1].pk
+                for book in batch:
+                    bids, asks = _best_first(book.bids, True), _best_first(book.asks, False)
+                    timestamp_ms = int(book.timestamp.timestamp() * 1000)
+                    book.encoded_book = encode_for_config(config, bids, asks, timestamp_ms, book.sequence)
+                    json_bytes += len(json.dumps(book.bids, default=str)) + len(json.dumps(book.asks, default=str))
+                    binary_bytes += len(book.encoded_book)
+                    book.bids, book.asks = [], []
+                rows += len(batch)
+                if not options['dry_run']:
+                    with transaction.atomic():
+                        MarketDataOrderBook.objects.bulk_update(batch, ['encoded_book', 'bids', 'asks'])
+                    converted += len(batch)
+
+            ratio = json_bytes / binary_bytes if binary_bytes else 0.0
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Config {config.id}: {rows:,} rows encoded, {converted:,} written "
+                    f"({json_bytes:,} -> {binary_bytes:,} bytes, {ratio:.1f}x smaller)."
+                )
+            )
@@ -0,0 +1,31 @@
+# apps/market_data/management/commands/rebuild_coverage.py
+
+from django.core.management.base import BaseCommand, CommandError
+from apps.market_data.coverage import rebuild_coverage
+from apps.market_data.models import MarketDataConfig
+
+
+class Command(BaseCommand):
+    help = 'Builds the OHLCV coverage index (MarketDataCoverage) from stored candles, e.g. after the first deploy.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--config-id',
+            action='append',
+            dest='config_ids',
+            help='MarketDataConfig id to rebuild (repeatable). Default: every OHLCV config.',
+        )
+
+    def handle(self, *args, **options):
+        configs = MarketDataConfig.objects.filter(data_type='OHLCV')
+        if options['config_ids']:
+            configs = configs.filter(id__in=options['config_ids'])
+        configs = list(configs)
+        if not configs:
+            raise CommandError('No OHLCV configs selected.')
+
+        for config in configs:
+            index = rebuild_coverage(config)
+            self.stdout.write(
+                self.style.SUCCESS(f"Config {config.id}: {index.bar_count:,} bars in {len(index.bars):,} intervals.")
+            )
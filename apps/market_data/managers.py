@@ -2,7 +2,7 @@
 
 from django.db import models
 from django.utils import timezone
-from datetime import timedelta
+from datetime import datetime, timezone as dt_timezone
 from decimal import Decimal
 from .models import MarketDataSnapshot, MarketDataOrderBook, MarketDataTick, MarketDataConfig
 
@@ -106,108 +106,67 @@ class MarketDataSnapshotQuerySet(models.QuerySet):
         Calculates VWAP (Volume Weighted Average Price) for a given config and time range.
         This is a simplified example; a more robust implementation might be needed for production.
         """
-        snapshots = self.for_config(config).in_date_range(start_time, end_time)
-        total_value = Decimal('0')
-        total_volume = Decimal('0')
-        for snap in snapshots:
-            # قیمت میانگین (High + Low + Close) / 3 یا Close فقط
-            avg_price = (snap.high_price + snap.low_price + snap.close_price) / 3
-            total_value += avg_price * snap.volume
-            total_volume += snap.volume
+        from .storage import load_ohlcv_arrays # Import داخل تابع برای جلوگیری از حلقه
 
+        # همان بازه in_date_range (از ابتدای روز شروع تا انتهای روز پایان)، بدون ساخت نمونه‌های مدل
+        range_start = start_time.replace(hour=0, minute=0, second=0, microsecond=0)
+        range_end = end_time.replace(hour=23, minute=59, second=59, microsecond=999999)
+        arrays = load_ohlcv_arrays(config, range_start, range_end)
+
+        # قیمت میانگین (High + Low + Close) / 3
+        typical_price = (arrays.high_price + arrays.low_price + arrays.close_price) / 3
+        total_volume = arrays.volume.sum()
         if total_volume > 0:
-            return total_value / total_volume
+            return Decimal(str(float((typical_price * arrays.volume).sum() / total_volume)))
         else:
             return Decimal('0') # یا None یا ایجاد یک استثنا
 
-    def calculate_periodic_ohlc(self, config, start_time, end_time, aggregation_period='1h'):
+    def calculate_periodic_ohlc(self, config, start_time, end_time, aggregation_period='1h', alignment='UTC'):
         """
         Aggregates snapshots within a time range into periodic OHLC data (e.g., 1h candles from 1m data).
-        This is a more complex operation, often handled by the database engine itself (e.g., TimescaleDB).
-        This method provides a basic Django ORM implementation.
-        """
-        # توجه: این یک پیاده‌سازی ساده است. برای حجم زیاد داده، استفاده از SQL خام یا یک پایگاه داده سری زمانی مانند TimescaleDB توصیه می‌شود.
-        snapshots = self.for_config(config).filter(
-            timestamp__gte=start_time,
-            timestamp__lte=end_time
-        ).order_by('timestamp')
-
-        if not snapshots.exists():
-            return []
-
-        # تبدیل aggregation_period به تایم دلتا (مثلاً '1h' -> timedelta(hours=1))
-        # این قسمت نیاز به یک تابع تجزیه ساده دارد
-        import re
-        match = re.match(r'(\d+)([smhdw])', aggregation_period)
-        if not match:
-            raise ValueError("Invalid aggregation period format. Use e.g., '1m', '5m', '1h', '1d'.")
-        num, unit = match.groups()
-        num = int(num)
-        if unit == 's':
-            delta = timedelta(seconds=num)
-        elif unit == 'm':
-            delta = timedelta(minutes=num)
-        elif unit == 'h':
-            delta = timedelta(hours=num)
-        elif unit == 'd':
-            delta = timedelta(days=num)
-        elif unit == 'w':
-            delta = timedelta(weeks=num)
-        else:
-            raise ValueError(f"Unsupported time unit: {unit}")
-
-        # گروه‌بندی و محاسبه OHLC
-        aggregated_data = []
-        current_bucket_start = None
-        bucket_open = None
-        bucket_high = Decimal('-Infinity')
-        bucket_low = Decimal('Infinity')
-        bucket_close = None
-        bucket_volume = Decimal('0')
-
-        for snap in snapshots:
-            bucket_start_time = snap.timestamp.replace(
-                second=0, microsecond=0
-            ) + timedelta(minutes=(snap.timestamp.minute // num) * num)
-
-            if current_bucket_start is None:
-                current_bucket_start = bucket_start_time
-                bucket_open = snap.open_price
-            elif snap.timestamp < current_bucket_start + delta:
-                # داخل همان باکت
-                pass
-            else:
-                # اتمام باکت فعلی، ذخیره و شروع باکت جدید
-                if bucket_open is not None: # اگر حداقل یک داده در باکت بود
-                    aggregated_data.append({
-                        'timestamp': current_bucket_start,
-                        'open': bucket_open,
-                        'high': bucket_high,
-                        'low': bucket_low,
-                        'close': bucket_close,
-                        'volume': bucket_volume
-                    })
-                current_bucket_start = bucket_start_time
-                bucket_open = snap.open_price
-
-            # بروزرسانی OHLC و حجم برای باکت فعلی
-            bucket_high = max(bucket_high, snap.high_price)
-            bucket_low = min(bucket_low, snap.low_price)
-            bucket_close = snap.close_price # آخرین close در باکت
-            bucket_volume += snap.volume
-
-        # ذخیره آخرین باکت
-        if bucket_open is not None:
-             aggregated_data.append({
-                 'timestamp': current_bucket_start,
-                 'open': bucket_open,
-                 'high': bucket_high,
-                 'low': bucket_low,
-                 'close': bucket_close,
-                 'volume': bucket_volume
-             })
-
-        return aggregated_data
+        Uses materialized buckets from the columnar store when available, otherwise resamples
+        the source candles with the vectorized engine in apps/market_data/resampling.py.
+        """
+        from .resampling import bucket_starts, get_bucket_offset_ms, resample_ohlcv, timeframe_to_ms # Import داخل تابع برای جلوگیری از حلقه
+        from .storage import OHLCVArrays, columnar_store, is_columnar_store_enabled, load_ohlcv_arrays, merge_records, to_epoch_ms
+
+        bucket_ms = timeframe_to_ms(aggregation_period) # ValueError برای فرمت نامعتبر
+        offset_ms = get_bucket_offset_ms(aggregation_period, alignment, config.data_source)
+        # شروع بازه به ابتدای باکت خودش برده می‌شود تا هر دو مسیر باکت اول را کامل برگردانند
+        start_ms = int(bucket_starts([to_epoch_ms(start_time)], bucket_ms, offset_ms)[0])
+        end_ms = to_epoch_ms(end_time)
+
+        # 1. باکت‌های از پیش ساخته‌شده (rollup / materialize_timeframe_task) اگر انتهای بازه را پوشش دهند
+        aggregated = None
+        if is_columnar_store_enabled() and aggregation_period != config.timeframe:
+            last_materialized = columnar_store.last_timestamp(config.id, aggregation_period)
+            if last_materialized is not None and last_materialized + bucket_ms > end_ms:
+                aggregated = columnar_store.read_range(config.id, aggregation_period, start_ms, end_ms)
+                # باکت‌ها فقط از زمان استقرار ساخته شده‌اند؛ ابتدای بازه از کندل‌های منبع نمونه‌برداری می‌شود
+                first_materialized = columnar_store.first_timestamp(config.id, aggregation_period)
+                if first_materialized > start_ms:
+                    prefix = resample_ohlcv(load_ohlcv_arrays(config, start_ms, first_materialized - 1), aggregation_period, offset_ms)
+                    aggregated = OHLCVArrays.from_records(merge_records(prefix.to_records(), aggregated.to_records()))
+
+        # 2. در غیر این صورت نمونه‌برداری مجدد برداری از کندل‌های منبع
+        if aggregated is None:
+            source = load_ohlcv_arrays(config, start_ms, end_ms)
+            aggregated = resample_ohlcv(source, aggregation_period, offset_ms)
+
+        return [
+            {
+                'timestamp': datetime.fromtimestamp(int(ts) / 1000.0, tz=dt_timezone.utc),
+                'open': Decimal(str(float(o))),
+                'high': Decimal(str(float(h))),
+                'low': Decimal(str(float(l))),
+                'close': Decimal(str(float(c))),
+                'volume': Decimal(str(float(v))),
+            }
+            for ts, o, h, l, c, v in zip(
+                aggregated.timestamp, aggregated.open_price, aggregated.high_price,
+                aggregated.low_price, aggregated.close_price, aggregated.volume,
+            )
+        ]
 
 
 class MarketDataSnapshotManager(models.Manager):
@@ -0,0 +1,83 @@
+import uuid
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market_data', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='marketdataconfig',
+            name='use_binary_order_book',
+            field=models.BooleanField(default=False, verbose_name='Use Binary Order Book Encoding'),
+        ),
+        # مدل‌های OrderBook/Tick/Cache در 0001 وجود ندارند
+        migrations.CreateModel(
+            name='MarketDataOrderBook',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated At')),
+                ('timestamp', models.DateTimeField(verbose_name='Timestamp')),
+                ('bids', models.JSONField(default=list, verbose_name='Bids (JSON Array of [Price, Quantity])')),
+                ('asks', models.JSONField(default=list, verbose_name='Asks (JSON Array of [Price, Quantity])')),
+                ('sequence', models.BigIntegerField(blank=True, null=True, verbose_name='Sequence Number (if provided by source)')),
+                ('checksum', models.CharField(blank=True, max_length=64, null=True, verbose_name='Checksum (if provided by source)')),
+                ('encoded_book', models.BinaryField(blank=True, null=True, verbose_name='Encoded Order Book (binary)')),
+                ('config', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order_books', to='market_data.marketdataconfig', verbose_name='Market Data Config')),
+            ],
+            options={
+                'verbose_name': 'Market Data Order Book',
+                'verbose_name_plural': 'Market Data Order Books',
+                'indexes': [models.Index(fields=['config', '-timestamp'], name='market_data_config__c395d1_idx'), models.Index(fields=['timestamp'], name='market_data_timesta_ae9593_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='MarketDataTick',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated At')),
+                ('timestamp', models.DateTimeField(verbose_name='Timestamp')),
+                ('price', models.DecimalField(decimal_places=8, max_digits=20, verbose_name='Price')),
+                ('quantity', models.DecimalField(decimal_places=8, max_digits=30, verbose_name='Quantity')),
+                ('side', models.CharField(choices=[('BUY', 'Buy'), ('SELL', 'Sell')], max_length=4, verbose_name='Side')),
+                ('trade_id', models.CharField(blank=True, max_length=128, null=True, verbose_name='Trade ID (if provided by source)')),
+                ('config', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ticks', to='market_data.marketdataconfig', verbose_name='Market Data Config')),
+            ],
+            options={
+                'verbose_name': 'Market Data Tick',
+                'verbose_name_plural': 'Market Data Ticks',
+                'indexes': [models.Index(fields=['config', '-timestamp'], name='market_data_config__ff44fd_idx'), models.Index(fields=['timestamp'], name='market_data_timesta_89a156_idx'), models.Index(fields=['config', 'side'], name='market_data_config__8afbd5_idx')],
+            },
+        ),
+        # قید یکتای trade_id (برای bulk_create با ignore_conflicts در TickBatcher)
+        migrations.AddConstraint(
+            model_name='marketdatatick',
+            constraint=models.UniqueConstraint(
+                condition=models.Q(trade_id__isnull=False),
+                fields=('config', 'trade_id'),
+                name='unique_tick_trade_id_per_config',
+            ),
+        ),
+        migrations.CreateModel(
+            name='MarketDataCache',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated At')),
+                ('latest_snapshot', models.JSONField(blank=True, default=dict, verbose_name='Latest Snapshot (JSON)')),
+                ('cached_at', models.DateTimeField(auto_now_add=True, verbose_name='Cached At')),
+                ('config', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='cache', to='market_data.marketdataconfig', verbose_name='Market Data Config')),
+            ],
+            options={
+                'verbose_name': 'Market Data Cache',
+                'verbose_name_plural': 'Market Data Caches',
+            },
+        ),
+    ]
@@ -0,0 +1,45 @@
+from django.db import migrations, models
+
+PARTITIONED_TABLES = {
+    'MarketDataSnapshot': 'market_data_marketdatasnapshot',
+    'MarketDataTick': 'market_data_marketdatatick',
+    'MarketDataOrderBook': 'market_data_marketdataorderbook',
+}
+
+
+def partition_tables(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return # پارتیشن‌بندی فقط روی PostgreSQL/TimescaleDB
+    from apps.market_data.partitioning import PartitionManager, choose_partition_backend
+
+    MarketDataConfig = apps.get_model('market_data', 'MarketDataConfig')
+    timescale_requested = MarketDataConfig.objects.filter(storage_backend='TIMESCALE').exists()
+    manager = PartitionManager(using=schema_editor.connection.alias)
+    with schema_editor.connection.cursor() as cursor:
+        backend_name = choose_partition_backend(cursor, timescale_requested)
+    for model_name, table in PARTITIONED_TABLES.items():
+        manager.convert_table(table, model_name, backend_name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market_data', '0002_order_book_binary_encoding'),
+    ]
+
+    operations = [
+        # ایندکس‌های یکتای جدول پارتیشن‌شده باید ستون پارتیشن را شامل شوند
+        migrations.RemoveConstraint(
+            model_name='marketdatatick',
+            name='unique_tick_trade_id_per_config',
+        ),
+        migrations.AddConstraint(
+            model_name='marketdatatick',
+            constraint=models.UniqueConstraint(
+                condition=models.Q(trade_id__isnull=False),
+                fields=('config', 'trade_id', 'timestamp'),
+                name='unique_tick_trade_id_per_config',
+            ),
+        ),
+        migrations.RunPython(partition_tables, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+from django.db import migrations, models
+
+
+def remove_duplicate_snapshots(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    # قبل از افزودن قید یکتا، از هر (config, timestamp) فقط آخرین ردیف درج‌شده نگه داشته می‌شود
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            """
+            DELETE FROM market_data_marketdatasnapshot older
+            USING market_data_marketdatasnapshot newer
+            WHERE older.config_id = newer.config_id
+              AND older.timestamp = newer.timestamp
+              AND (older.created_at, older.ctid) < (newer.created_at, newer.ctid)
+            """
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market_data', '0003_time_partitioned_market_data'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_snapshots, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='marketdatasnapshot',
+            constraint=models.UniqueConstraint(fields=('config', 'timestamp'), name='unique_snapshot_per_config_timestamp'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+import uuid
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market_data', '0004_snapshot_unique_config_timestamp'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MarketDataCoverage',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated At')),
+                ('intervals', models.JSONField(blank=True, default=list, verbose_name='Covered Intervals (JSON Array of [Start, End] ms)')),
+                ('empty_intervals', models.JSONField(blank=True, default=list, verbose_name='Known Empty Intervals (JSON Array of [Start, End] ms)')),
+                ('bar_count', models.BigIntegerField(default=0, verbose_name='Bar Count')),
+                ('config', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='coverage', to='market_data.marketdataconfig', verbose_name='Market Data Config')),
+            ],
+            options={
+                'verbose_name': 'Market Data Coverage',
+                'verbose_name_plural': 'Market Data Coverages',
+            },
+        ),
+    ]
@@ -119,6 +119,8 @@ class MarketDataConfig(BaseModel):
         verbose_name=_("Depth Levels (for Order Book)")
     )
     include_additional_fields = models.JSONField(default=list, blank=True, verbose_name=_("Include Additional Fields (JSON Array)"))
+    # ذخیره/کش/ارسال دفتر سفارش با کدک باینری (order_book_codec) به جای JSON
+    use_binary_order_book = models.BooleanField(default=False, verbose_name=_("Use Binary Order Book Encoding"))
 
     class Meta:
         verbose_name = _("Market Data Config")
@@ -169,8 +171,11 @@ class MarketDataSnapshot(BaseModel):
             models.Index(fields=['timestamp']),
             models.Index(fields=['config', 'timestamp']), # برای بازه زمانی روی یک کانفیگ
         ]
-        # می‌توانید از TimescaleDB Hypertable برای این مدل استفاده کنید:
-        # db_table = "market_data_snapshot"  # اگر با TimescaleDB کار می‌کنید
+        constraints = [
+            # هر کانفیگ در هر زمان فقط یک کندل دارد؛ مبنای upsert در backfill و دریافت زنده
+            models.UniqueConstraint(fields=['config', 'timestamp'], name='unique_snapshot_per_config_timestamp'),
+        ]
+        # جدول بر اساس timestamp پارتیشن‌بندی شده است (partitioning.py، migration 0003)
 
     def __str__(self):
         return f"{self.config.instrument.symbol} at {self.timestamp} - C:{self.close_price}"
@@ -192,6 +197,8 @@ class MarketDataOrderBook(BaseModel):
     asks = models.JSONField(default=list, verbose_name=_("Asks (JSON Array of [Price, Quantity])")) # مثلاً [[price1, qty1], [price2, qty2], ...]
     sequence = models.BigIntegerField(null=True, blank=True, verbose_name=_("Sequence Number (if provided by source)"))
     checksum = models.CharField(max_length=64, null=True, blank=True, verbose_name=_("Checksum (if provided by source)"))
+    # نسخه باینری فشرده bids/asks؛ وقتی پر است bids/asks خالی می‌مانند
+    encoded_book = models.BinaryField(null=True, blank=True, verbose_name=_("Encoded Order Book (binary)"))
 
     class Meta:
         verbose_name = _("Market Data Order Book")
@@ -204,6 +211,16 @@ class MarketDataOrderBook(BaseModel):
     def __str__(self):
         return f"Order Book for {self.config.instrument.symbol} at {self.timestamp}"
 
+    def get_levels(self):
+        """
+        Bids and asks as LEVEL_DTYPE structured arrays (best first), from the binary or JSON form.
+        """
+        from .order_book_codec import levels_to_array, decode_order_book # Import داخل تابع برای جلوگیری از حلقه
+        if self.encoded_book:
+            decoded = decode_order_book(self.encoded_book)
+            return decoded.bids, decoded.asks
+        return levels_to_array(self.bids or []), levels_to_array(self.asks or [])
+
 
 class MarketDataTick(BaseModel):
     """
@@ -230,6 +247,15 @@ class MarketDataTick(BaseModel):
             models.Index(fields=['timestamp']),
             models.Index(fields=['config', 'side']),
         ]
+        constraints = [
+            # برای bulk_create با ignore_conflicts: هر trade_id در هر کانفیگ فقط یک بار ذخیره می‌شود
+            # (timestamp به دلیل پارتیشن‌بندی زمانی جدول جزو کلید است؛ زمان یک معامله ثابت است)
+            models.UniqueConstraint(
+                fields=['config', 'trade_id', 'timestamp'],
+                condition=models.Q(trade_id__isnull=False),
+                name='unique_tick_trade_id_per_config',
+            ),
+        ]
 
     def __str__(self):
         return f"Tick: {self.side} {self.quantity} @ {self.price} for {self.config.instrument.symbol} at {self.timestamp}"
@@ -289,3 +315,26 @@ class MarketDataCache(BaseModel):
 
     def __str__(self):
         return f"Cache for {self.config}"
+
+
+class MarketDataCoverage(BaseModel):
+    """
+    ایندکس پوشش سری OHLCV هر کانفیگ: بازه‌های [start_ms, end_ms) کندل‌های موجود
+    و بازه‌هایی که منبع داده کندلی برای آن‌ها ندارد (مثل توقف معاملات).
+    """
+    config = models.OneToOneField(
+        "market_data.MarketDataConfig",
+        on_delete=models.CASCADE,
+        related_name="coverage",
+        verbose_name=_("Market Data Config")
+    )
+    intervals = models.JSONField(default=list, blank=True, verbose_name=_("Covered Intervals (JSON Array of [Start, End] ms)"))
+    empty_intervals = models.JSONField(default=list, blank=True, verbose_name=_("Known Empty Intervals (JSON Array of [Start, End] ms)"))
+    bar_count = models.BigIntegerField(default=0, verbose_name=_("Bar Count"))
+
+    class Meta:
+        verbose_name = _("Market Data Coverage")
+        verbose_name_plural = _("Market Data Coverages")
+
+    def __str__(self):
+        return f"Coverage for {self.config} ({self.bar_count} bars)"
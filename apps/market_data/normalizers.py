@@ -0,0 +1,500 @@
+# apps/market_data/normalizers.py
+
+"""
+Per-source message normalizers for real-time and REST market data.
+
+Each (exchange code, data type) pair has one normalizer class, registered with
+@register_normalizer and resolved once when a config is subscribed (get_normalizer /
+resolve_normalizer), so the hot path does no source/type string branching. decode()
+turns a parsed payload into a slotted record whose prices and quantities are fixed-point
+ints (units of 10**-scale) parsed straight from the exchange's decimal strings, without
+Decimal or float. Decimal is only built at the boundary (to_dict), and decode_array()
+returns int64 NumPy structured arrays for batches. The fixed-point primitives live in
+apps.core.fixed_point.
+
+Frames are parsed with orjson when it is installed (json otherwise).
+"""
+
+import json
+import logging
+from datetime import datetime, timezone as dt_timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type
+
+import numpy as np
+
+from apps.core.fixed_point import DEFAULT_DECIMALS, parse_scaled, scaled_to_decimal
+
+try:
+    import orjson
+except ImportError:  # orjson اختیاری است
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# مقیاس پیش‌فرض اعداد ثابت‌نقطه (۸ رقم اعشار، دقت بایننس)
+PRICE_SCALE = DEFAULT_DECIMALS
+QUANTITY_SCALE = DEFAULT_DECIMALS
+
+loads = orjson.loads if orjson is not None else json.loads
+
+
+_iso_seconds: Dict[str, int] = {}
+
+
+def _iso_to_ms(value: str) -> int:
+    # 'YYYY-MM-DDTHH:MM:SS.mmm' (LBank): ثانیه‌ها کش می‌شوند و فقط میلی‌ثانیه پارس می‌شود
+    if len(value) == 23 and value[19] == '.':
+        seconds = _iso_seconds.get(value[:19])
+        if seconds is None:
+            if len(_iso_seconds) >= 4096:
+                _iso_seconds.clear()
+            seconds = _iso_seconds[value[:19]] = _parse_iso_ms(value[:19])
+        return seconds + int(value[20:])
+    return _parse_iso_ms(value)
+
+
+def _parse_iso_ms(value: str) -> int:
+    # زمان بدون منطقه زمانی، UTC در نظر گرفته می‌شود
+    moment = datetime.fromisoformat(value[:-1] + '+00:00' if value[-1] == 'Z' else value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=dt_timezone.utc)
+    return int(moment.timestamp() * 1000)
+
+
+# --- رکوردهای نرمال‌شده (فشرده با __slots__) ---
+
+CANDLE_DTYPE = np.dtype([
+    ('timestamp', 'i8'), ('open', 'i8'), ('high', 'i8'), ('low', 'i8'), ('close', 'i8'),
+    ('volume', 'i8'), ('quote_volume', 'i8'), ('number_of_trades', 'i8'),
+])
+TRADE_DTYPE = np.dtype([('timestamp', 'i8'), ('price', 'i8'), ('quantity', 'i8'), ('side', 'i1')])
+
+
+class Candle:
+    """
+    OHLCV bar; timestamp is the open time in epoch ms, prices/volumes are fixed-point ints.
+    """
+    __slots__ = ('timestamp', 'open', 'high', 'low', 'close', 'volume', 'close_time',
+                 'quote_volume', 'number_of_trades', 'taker_buy_base', 'taker_buy_quote', 'is_closed')
+
+    def __init__(self, timestamp, open, high, low, close, volume, close_time=None, quote_volume=None,
+                 number_of_trades=None, taker_buy_base=None, taker_buy_quote=None, is_closed=None):
+        self.timestamp = timestamp
+        self.open = open
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+        self.close_time = close_time
+        self.quote_volume = quote_volume
+        self.number_of_trades = number_of_trades
+        self.taker_buy_base = taker_buy_base
+        self.taker_buy_quote = taker_buy_quote
+        self.is_closed = is_closed
+
+    def as_tuple(self) -> tuple:
+        return (self.timestamp, self.open, self.high, self.low, self.close, self.volume,
+                self.quote_volume or 0, self.number_of_trades or 0)
+
+    def to_dict(self, price_scale: int = PRICE_SCALE, quantity_scale: int = QUANTITY_SCALE,
+                number: Callable = scaled_to_decimal) -> Dict[str, Any]:
+        additional = {} if self.is_closed is None else {'is_closed': self.is_closed}
+        return {
+            'timestamp': self.timestamp,
+            'open': number(self.open, price_scale),
+            'high': number(self.high, price_scale),
+            'low': number(self.low, price_scale),
+            'close': number(self.close, price_scale),
+            'volume': number(self.volume, quantity_scale),
+            'close_time': self.close_time,
+            'quote_volume': number(self.quote_volume, price_scale),
+            'number_of_trades': self.number_of_trades,
+            'taker_buy_base_asset_volume': number(self.taker_buy_base, quantity_scale),
+            'taker_buy_quote_asset_volume': number(self.taker_buy_quote, price_scale),
+            'additional_data': additional,
+        }
+
+
+class Trade:
+    """
+    Single trade; side is the taker (aggressor) side.
+    """
+    __slots__ = ('timestamp', 'price', 'quantity', 'side', 'trade_id')
+
+    def __init__(self, timestamp, price, quantity, side, trade_id=None):
+        self.timestamp = timestamp
+        self.price = price
+        self.quantity = quantity
+        self.side = side
+        self.trade_id = trade_id
+
+    def as_tuple(self) -> tuple:
+        return (self.timestamp, self.price, self.quantity, 1 if self.side == 'BUY' else -1)
+
+    def to_dict(self, price_scale: int = PRICE_SCALE, quantity_scale: int = QUANTITY_SCALE,
+                number: Callable = scaled_to_decimal) -> Dict[str, Any]:
+        return {
+            'timestamp': self.timestamp,
+            'price': number(self.price, price_scale),
+            'quantity': number(self.quantity, quantity_scale),
+            'side': self.side,
+            'trade_id': self.trade_id,
+        }
+
+
+class BookUpdate:
+    """
+    Order book snapshot or diff; levels are [(price, quantity)] fixed-point int pairs.
+    """
+    __slots__ = ('timestamp', 'bids', 'asks', 'sequence', 'first_sequence', 'checksum')
+
+    def __init__(self, timestamp, bids, asks, sequence=None, first_sequence=None, checksum=None):
+        self.timestamp = timestamp
+        self.bids = bids
+        self.asks = asks
+        self.sequence = sequence
+        self.first_sequence = first_sequence
+        self.checksum = checksum
+
+    def to_dict(self, price_scale: int = PRICE_SCALE, quantity_scale: int = QUANTITY_SCALE,
+                number: Callable = scaled_to_decimal) -> Dict[str, Any]:
+        return {
+            'timestamp': self.timestamp,
+            'bids': [[number(price, price_scale), number(quantity, quantity_scale)] for price, quantity in self.bids],
+            'asks': [[number(price, price_scale), number(quantity, quantity_scale)] for price, quantity in self.asks],
+            'sequence': self.sequence,
+            'first_sequence': self.first_sequence,
+            'checksum': self.checksum,
+        }
+
+
+# --- رجیستری نرمالایزرها ---
+
+_NORMALIZERS: Dict[Tuple[str, str], Type['MessageNormalizer']] = {}
+_instances: Dict[Tuple[str, str], 'MessageNormalizer'] = {}
+
+# نام‌های معادل data_type
+DATA_TYPE_ALIASES = {'TRADES': 'TICK'}
+
+
+def register_normalizer(code: str, data_type: str):
+    def decorator(cls):
+        cls.code = code
+        cls.data_type = data_type
+        _NORMALIZERS[(code, data_type)] = cls
+        return cls
+    return decorator
+
+
+def get_normalizer(code: str, data_type: str) -> Optional['MessageNormalizer']:
+    """
+    Shared normalizer instance for an exchange code and data type, or None if unsupported.
+    """
+    key = (str(code).upper(), DATA_TYPE_ALIASES.get(data_type, data_type))
+    normalizer = _instances.get(key)
+    if normalizer is None:
+        normalizer_class = _NORMALIZERS.get(key)
+        if normalizer_class is None:
+            return None
+        normalizer = _instances.setdefault(key, normalizer_class())
+    return normalizer
+
+
+def resolve_normalizer(config) -> Optional['MessageNormalizer']:
+    """
+    Normalizer of a MarketDataConfig, resolved from its DataSource code and data type.
+    """
+    from apps.market_data.streams import get_source_code # Import داخل تابع برای جلوگیری از حلقه
+    return get_normalizer(get_source_code(config.data_source), config.data_type)
+
+
+def get_registered_normalizers() -> List[Tuple[str, str]]:
+    return sorted(_NORMALIZERS)
+
+
+class MessageNormalizer:
+    """
+    Decodes one exchange's payloads of one data type. decode() returns a record, or None for
+    payloads that carry no data (acks, other event types).
+    """
+    code = None
+    data_type = None
+    record_dtype = None
+    price_scale = PRICE_SCALE
+    quantity_scale = QUANTITY_SCALE
+
+    def decode(self, payload):
+        raise NotImplementedError
+
+    def decode_raw(self, raw):
+        """
+        Parses a raw frame (str/bytes) and decodes it.
+        """
+        return self.decode(loads(raw))
+
+    def decode_many(self, payload) -> List:
+        """
+        Records of a batch payload (e.g. a REST response); by default a list of single payloads.
+        """
+        records = []
+        for item in payload or []:
+            record = self.decode(item)
+            if record is not None:
+                records.append(record)
+        return records
+
+    def decode_array(self, payload) -> np.ndarray:
+        """
+        int64 NumPy structured array (record_dtype) of a batch payload.
+        """
+        return np.array([record.as_tuple() for record in self.decode_many(payload)], dtype=self.record_dtype)
+
+    def normalize(self, payload, number: Callable = scaled_to_decimal) -> Optional[Dict[str, Any]]:
+        """
+        Normalized dict of a payload; numbers are exact Decimals, or strings with number=format_scaled.
+        """
+        record = self.decode(payload)
+        if record is None:
+            return None
+        return record.to_dict(self.price_scale, self.quantity_scale, number)
+
+
+# --- Binance ---
+
+@register_normalizer('BINANCE', 'OHLCV')
+class BinanceKlineNormalizer(MessageNormalizer):
+    """
+    Kline stream events ({'e': 'kline', 'k': {...}}) and REST kline rows
+    ([open time, open, high, low, close, volume, close time, quote volume, trades, taker base, taker quote, -]).
+    """
+    record_dtype = CANDLE_DTYPE
+
+    def decode(self, payload):
+        if type(payload) is list:
+            return self._decode_row(payload)
+        kline = payload.get('k')
+        if kline is None:
+            return None
+        if type(kline) is list:
+            return self._decode_row(kline)
+        price, quantity = self.price_scale, self.quantity_scale
+        return Candle(
+            kline['t'],
+            parse_scaled(kline['o'], price),
+            parse_scaled(kline['h'], price),
+            parse_scaled(kline['l'], price),
+            parse_scaled(kline['c'], price),
+            parse_scaled(kline['v'], quantity),
+            close_time=kline['T'],
+            quote_volume=parse_scaled(kline['q'], price),
+            number_of_trades=kline['n'],
+            taker_buy_base=parse_scaled(kline['V'], quantity),
+            taker_buy_quote=parse_scaled(kline['Q'], price),
+            is_closed=kline['x'],
+        )
+
+    def _decode_row(self, row):
+        price, quantity = self.price_scale, self.quantity_scale
+        return Candle(
+            int(row[0]),
+            parse_scaled(row[1], price),
+            parse_scaled(row[2], price),
+            parse_scaled(row[3], price),
+            parse_scaled(row[4], price),
+            parse_scaled(row[5], quantity),
+            close_time=int(row[6]),
+            quote_volume=parse_scaled(row[7], price),
+            number_of_trades=int(row[8]),
+            taker_buy_base=parse_scaled(row[9], quantity),
+            taker_buy_quote=parse_scaled(row[10], price),
+        )
+
+
+@register_normalizer('BINANCE', 'TICK')
+class BinanceTradeNormalizer(MessageNormalizer):
+    """
+    Trade stream events ({'e': 'trade', 'p', 'q', 'T', 'm', 't'}); m=True means the buyer was the maker.
+    """
+    record_dtype = TRADE_DTYPE
+
+    def decode(self, payload):
+        if 'p' not in payload:
+            return None
+        return Trade(
+            payload['T'],
+            parse_scaled(payload['p'], self.price_scale),
+            parse_scaled(payload['q'], self.quantity_scale),
+            'SELL' if payload['m'] else 'BUY',
+            payload.get('t'),
+        )
+
+
+@register_normalizer('BINANCE', 'ORDER_BOOK')
+class BinanceDepthNormalizer(MessageNormalizer):
+    """
+    depthUpdate diffs ({'b', 'a', 'U', 'u'}) and snapshots ({'lastUpdateId', 'bids', 'asks'}).
+    """
+
+    def decode(self, payload):
+        price, quantity = self.price_scale, self.quantity_scale
+        if 'lastUpdateId' in payload:
+            bids, asks = payload.get('bids', []), payload.get('asks', [])
+            sequence, first_sequence = payload['lastUpdateId'], None
+        elif 'u' in payload:
+            bids, asks = payload.get('b', []), payload.get('a', [])
+            sequence, first_sequence = payload['u'], payload.get('U')
+        else:
+            return None
+        return BookUpdate(
+            payload.get('E') or payload.get('T'),
+            [(parse_scaled(level[0], price), parse_scaled(level[1], quantity)) for level in bids],
+            [(parse_scaled(level[0], price), parse_scaled(level[1], quantity)) for level in asks],
+            sequence,
+            first_sequence,
+        )
+
+
+# --- Nobitex ---
+
+@register_normalizer('NOBITEX', 'OHLCV')
+class NobitexCandleNormalizer(MessageNormalizer):
+    """
+    Candle dicts ({'time'|'timestamp', 'open', 'high', 'low', 'close', 'volume'}; time in seconds or ms)
+    and UDF history responses ({'s': 'ok', 't': [...], 'o': [...], ...}, decoded column-wise).
+    """
+    record_dtype = CANDLE_DTYPE
+
+    def decode(self, payload):
+        timestamp = payload.get('time', payload.get('timestamp'))
+        if timestamp is None:
+            return None
+        timestamp = int(timestamp)
+        price, quantity = self.price_scale, self.quantity_scale
+        return Candle(
+            timestamp * 1000 if timestamp < 10_000_000_000 else timestamp,
+            parse_scaled(payload['open'], price),
+            parse_scaled(payload['high'], price),
+            parse_scaled(payload['low'], price),
+            parse_scaled(payload['close'], price),
+            parse_scaled(payload['volume'], quantity),
+        )
+
+    def decode_many(self, payload) -> List:
+        if isinstance(payload, dict):
+            if payload.get('s') != 'ok':
+                return []
+            price, quantity = self.price_scale, self.quantity_scale
+            return [
+                Candle(int(t) * 1000, parse_scaled(o, price), parse_scaled(h, price), parse_scaled(l, price),
+                       parse_scaled(c, price), parse_scaled(v, quantity))
+                for t, o, h, l, c, v in zip(payload['t'], payload['o'], payload['h'], payload['l'],
+                                            payload['c'], payload['v'])
+            ]
+        return super().decode_many(payload)
+
+
+@register_normalizer('NOBITEX', 'TICK')
+class NobitexTradeNormalizer(MessageNormalizer):
+    """
+    Trades ({'time' ms, 'price', 'volume', 'type': 'buy'|'sell'}).
+    """
+    record_dtype = TRADE_DTYPE
+
+    def decode(self, payload):
+        if 'price' not in payload:
+            return None
+        return Trade(
+            int(payload['time']),
+            parse_scaled(payload['price'], self.price_scale),
+            parse_scaled(payload['volume'], self.quantity_scale),
+            'BUY' if payload['type'] == 'buy' else 'SELL',
+        )
+
+    def decode_many(self, payload) -> List:
+        if isinstance(payload, dict):
+            payload = payload.get('trades', [])
+        return super().decode_many(payload)
+
+
+# --- LBank ---
+
+@register_normalizer('LBANK', 'OHLCV')
+class LBankKbarNormalizer(MessageNormalizer):
+    """
+    kbar pushes ({'type': 'kbar', 'kbar': {'t' ISO time, 'o', 'h', 'l', 'c', 'v', 'a', 'n'}}) and
+    REST kline rows ([time seconds, open, high, low, close, volume]).
+    """
+    record_dtype = CANDLE_DTYPE
+
+    def decode(self, payload):
+        price, quantity = self.price_scale, self.quantity_scale
+        if type(payload) is list:
+            return Candle(
+                int(payload[0]) * 1000,
+                parse_scaled(payload[1], price),
+                parse_scaled(payload[2], price),
+                parse_scaled(payload[3], price),
+                parse_scaled(payload[4], price),
+                parse_scaled(payload[5], quantity),
+            )
+        kbar = payload.get('kbar')
+        if kbar is None:
+            return None
+        return Candle(
+            _iso_to_ms(kbar['t']),
+            parse_scaled(kbar['o'], price),
+            parse_scaled(kbar['h'], price),
+            parse_scaled(kbar['l'], price),
+            parse_scaled(kbar['c'], price),
+            parse_scaled(kbar['v'], quantity),
+            quote_volume=parse_scaled(kbar['a'], price) if 'a' in kbar else None,
+            number_of_trades=kbar.get('n'),
+        )
+
+    def decode_many(self, payload) -> List:
+        if isinstance(payload, dict):
+            payload = payload.get('data', [])
+        return super().decode_many(payload)
+
+
+@register_normalizer('LBANK', 'TICK')
+class LBankTradeNormalizer(MessageNormalizer):
+    """
+    trade pushes ({'type': 'trade', 'trade': {'price', 'volume', 'direction', 'TS' ISO time}}).
+    """
+    record_dtype = TRADE_DTYPE
+
+    def decode(self, payload):
+        trade = payload.get('trade')
+        if trade is None:
+            return None
+        return Trade(
+            _iso_to_ms(trade['TS']),
+            parse_scaled(trade['price'], self.price_scale),
+            parse_scaled(trade['volume'], self.quantity_scale),
+            'BUY' if trade['direction'].startswith('buy') else 'SELL',
+        )
+
+
+# --- Coinbase ---
+
+@register_normalizer('COINBASE', 'OHLCV')
+class CoinbaseCandleNormalizer(MessageNormalizer):
+    """
+    Candle dicts ({'time', 'open', 'high', 'low', 'close', 'volume'}).
+    """
+    record_dtype = CANDLE_DTYPE
+
+    def decode(self, payload):
+        if 'time' not in payload:
+            return None
+        price = self.price_scale
+        return Candle(
+            int(payload['time']),
+            parse_scaled(payload['open'], price),
+            parse_scaled(payload['high'], price),
+            parse_scaled(payload['low'], price),
+            parse_scaled(payload['close'], price),
+            parse_scaled(payload['volume'], self.quantity_scale),
+        )
+
@@ -0,0 +1,433 @@
+# apps/market_data/order_book.py
+
+"""
+Live local order books maintained from depth diffs.
+
+Each side is a pair of parallel arrays sorted so the best level is at the end: a level is
+found by binary search (O(log n)) and the frequent updates near the top of the book only
+shift a few elements. Diffs are validated for sequence continuity and (optionally) checksum;
+on a gap the book is rebuilt from a REST snapshot and the buffered diffs are replayed.
+Only periodic snapshots truncated to the config's depth are persisted, not every diff.
+"""
+
+import bisect
+import json
+import logging
+import threading
+import time
+import zlib
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+
+from apps.core.metrics import metrics
+from .exceptions import OrderBookChecksumError, OrderBookSequenceGapError
+
+logger = logging.getLogger(__name__)
+
+METRIC_PREFIX = 'market_data.order_book'
+
+# تنظیمات پیش‌فرض دفتر سفارش؛ هر DataSource می‌تواند در config['order_book'] آن‌ها را بازنویسی کند
+DEFAULT_ORDER_BOOK = {
+    'checksum': None,          # None یا 'crc32'
+    'checksum_depth': 25,      # تعداد سطوح در محاسبه checksum
+    'max_levels': 5000,        # سقف سطوح نگهداری‌شده در هر سمت
+    'max_buffered_diffs': 10000,
+    'resync_cooldown_ms': 1000, # حداقل فاصله دو درخواست snapshot REST
+}
+
+
+def get_order_book_settings(data_source) -> Dict:
+    merged = dict(DEFAULT_ORDER_BOOK)
+    source_config = getattr(data_source, 'config', None) or {}
+    overrides = source_config.get('order_book') or {}
+    if isinstance(overrides, dict):
+        merged.update(overrides)
+    return merged
+
+
+def get_snapshot_interval_ms() -> int:
+    return int(float(getattr(settings, 'MARKET_DATA_ORDER_BOOK_SNAPSHOT_SECONDS', 10)) * 1000)
+
+
+def _format_number(value: float) -> str:
+    return np.format_float_positional(value, trim='-')
+
+
+def crc32_checksum(bids: List[Tuple[float, float]], asks: List[Tuple[float, float]]) -> int:
+    """
+    CRC32 (signed) over interleaved 'bid_price:bid_qty:ask_price:ask_qty' levels, best first.
+    """
+    parts = []
+    for index in range(max(len(bids), len(asks))):
+        if index < len(bids):
+            parts.extend((_format_number(bids[index][0]), _format_number(bids[index][1])))
+        if index < len(asks):
+            parts.extend((_format_number(asks[index][0]), _format_number(asks[index][1])))
+    value = zlib.crc32(':'.join(parts).encode())
+    return value - (1 << 32) if value >= (1 << 31) else value
+
+
+CHECKSUM_FUNCTIONS = {
+    'crc32': crc32_checksum,
+}
+
+
+class PriceLevels:
+    """
+    One side of a book. Keys are sorted ascending with the best level last
+    (key = price for bids, -price for asks).
+    """
+    __slots__ = ('is_bid', '_keys', '_quantities', 'max_levels')
+
+    def __init__(self, is_bid: bool, max_levels: Optional[int] = None):
+        self.is_bid = is_bid
+        self._keys: List[float] = []
+        self._quantities: List[float] = []
+        self.max_levels = max_levels
+
+    def __len__(self):
+        return len(self._keys)
+
+    def _key(self, price: float) -> float:
+        return price if self.is_bid else -price
+
+    def clear(self):
+        self._keys.clear()
+        self._quantities.clear()
+
+    def load(self, levels):
+        pairs = sorted(((self._key(float(price)), float(qty)) for price, qty in levels if float(qty) > 0))
+        self._keys = [key for key, _ in pairs]
+        self._quantities = [qty for _, qty in pairs]
+        self._trim()
+
+    def update(self, price: float, quantity: float):
+        """
+        Sets the quantity at a price level; quantity 0 removes the level.
+        """
+        key = self._key(price)
+        index = bisect.bisect_left(self._keys, key)
+        exists = index < len(self._keys) and self._keys[index] == key
+        if quantity <= 0:
+            if exists:
+                del self._keys[index]
+                del self._quantities[index]
+        elif exists:
+            self._quantities[index] = quantity
+        else:
+            self._keys.insert(index, key)
+            self._quantities.insert(index, quantity)
+            if self.max_levels and len(self._keys) > self.max_levels:
+                self._trim()
+
+    def _trim(self):
+        if self.max_levels and len(self._keys) > self.max_levels:
+            # دورترین سطوح (ابتدای آرایه) حذف می‌شوند
+            excess = len(self._keys) - self.max_levels
+            del self._keys[:excess]
+            del self._quantities[:excess]
+
+    def best(self) -> Optional[Tuple[float, float]]:
+        if not self._keys:
+            return None
+        key = self._keys[-1]
+        return (key if self.is_bid else -key), self._quantities[-1]
+
+    def top(self, n: int) -> List[Tuple[float, float]]:
+        """
+        The n best levels as (price, quantity), best first.
+        """
+        keys = self._keys[-n:] if n else []
+        quantities = self._quantities[-n:] if n else []
+        sign = 1.0 if self.is_bid else -1.0
+        return [(sign * key, qty) for key, qty in zip(reversed(keys), reversed(quantities))]
+
+    def depth(self, n: int) -> float:
+        return float(sum(self._quantities[-n:])) if n else 0.0
+
+    def to_arrays(self, n: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        count = len(self._keys) if n is None else min(n, len(self._keys))
+        if count == 0:
+            return np.empty(0), np.empty(0)
+        keys = np.asarray(self._keys[-count:])[::-1]
+        quantities = np.asarray(self._quantities[-count:])[::-1]
+        return (keys if self.is_bid else -keys), quantities
+
+
+class LocalOrderBook:
+    """
+    Local book of one config, kept in sync by sequenced diffs.
+    """
+
+    def __init__(self, config_id, max_levels: Optional[int] = None,
+                 checksum_fn: Optional[Callable] = None, checksum_depth: int = 25):
+        self.config_id = config_id
+        self.bids = PriceLevels(is_bid=True, max_levels=max_levels)
+        self.asks = PriceLevels(is_bid=False, max_levels=max_levels)
+        self.sequence: Optional[int] = None
+        self.timestamp: Optional[int] = None # epoch ms
+        self.is_synced = False
+        self.checksum_fn = checksum_fn
+        self.checksum_depth = checksum_depth
+
+    def load_snapshot(self, bids, asks, sequence: Optional[int] = None, timestamp: Optional[int] = None):
+        self.bids.load(bids)
+        self.asks.load(asks)
+        self.sequence = int(sequence) if sequence is not None else None
+        self.timestamp = timestamp
+        self.is_synced = True
+
+    def apply_diff(self, bids, asks, sequence: Optional[int] = None, first_sequence: Optional[int] = None,
+                   checksum=None, timestamp: Optional[int] = None) -> bool:
+        """
+        Applies one depth diff. Returns False for stale diffs (already contained in the book);
+        raises OrderBookSequenceGapError / OrderBookChecksumError when the book must be resynced.
+        """
+        if sequence is not None and self.sequence is not None:
+            sequence = int(sequence)
+            if sequence <= self.sequence:
+                return False
+            expected = self.sequence + 1
+            first = int(first_sequence) if first_sequence is not None else sequence
+            if first > expected:
+                self.is_synced = False
+                raise OrderBookSequenceGapError(f"Expected sequence {expected}, got {first} for config {self.config_id}.")
+        for price, qty in bids:
+            self.bids.update(float(price), float(qty))
+        for price, qty in asks:
+            self.asks.update(float(price), float(qty))
+        if sequence is not None:
+            self.sequence = int(sequence)
+        if timestamp is not None:
+            self.timestamp = timestamp
+        if checksum is not None and self.checksum_fn is not None:
+            local = self.checksum_fn(self.bids.top(self.checksum_depth), self.asks.top(self.checksum_depth))
+            if int(local) != int(checksum):
+                self.is_synced = False
+                raise OrderBookChecksumError(f"Checksum mismatch for config {self.config_id}: {local} != {checksum}.")
+        return True
+
+    # --- خوانش سریع ---
+    def best_bid(self) -> Optional[Tuple[float, float]]:
+        return self.bids.best()
+
+    def best_ask(self) -> Optional[Tuple[float, float]]:
+        return self.asks.best()
+
+    def mid_price(self) -> Optional[float]:
+        bid, ask = self.bids.best(), self.asks.best()
+        if bid is None or ask is None:
+            return None
+        return (bid[0] + ask[0]) / 2.0
+
+    def spread(self) -> Optional[float]:
+        bid, ask = self.bids.best(), self.asks.best()
+        if bid is None or ask is None:
+            return None
+        return ask[0] - bid[0]
+
+    def microprice(self) -> Optional[float]:
+        """
+        Top-of-book price weighted by the opposite side's size.
+        """
+        bid, ask = self.bids.best(), self.asks.best()
+        if bid is None or ask is None:
+            return None
+        total = bid[1] + ask[1]
+        if total <= 0:
+            return (bid[0] + ask[0]) / 2.0
+        return (bid[0] * ask[1] + ask[0] * bid[1]) / total
+
+    def depth(self, n: int) -> Dict[str, float]:
+        return {'bids': self.bids.depth(n), 'asks': self.asks.depth(n)}
+
+    def imbalance(self, n: int = 1) -> Optional[float]:
+        """
+        (bid depth - ask depth) / (bid depth + ask depth) over the n best levels, in [-1, 1].
+        """
+        bid_depth, ask_depth = self.bids.depth(n), self.asks.depth(n)
+        total = bid_depth + ask_depth
+        if total <= 0:
+            return None
+        return (bid_depth - ask_depth) / total
+
+    def snapshot(self, depth: Optional[int] = None) -> Dict:
+        n = depth or max(len(self.bids), len(self.asks))
+        return {
+            'timestamp': self.timestamp,
+            'sequence': self.sequence,
+            'bids': [[price, qty] for price, qty in self.bids.top(n)],
+            'asks': [[price, qty] for price, qty in self.asks.top(n)],
+        }
+
+
+def fetch_rest_depth_snapshot(config) -> Optional[Dict]:
+    """
+    Fetches a full depth snapshot over REST using the data source's stream protocol.
+    """
+    from urllib.request import urlopen
+    from .streams import get_source_code, get_stream_protocol # Import داخل تابع برای جلوگیری از حلقه
+
+    protocol = get_stream_protocol(get_source_code(config.data_source))
+    url = protocol.depth_snapshot_url(config) if protocol else None
+    if not url:
+        return None
+    with urlopen(url, timeout=10) as response:
+        payload = json.loads(response.read())
+    return protocol.parse_depth_event(payload)
+
+
+class OrderBookEngine:
+    """
+    Keeps one LocalOrderBook per config, resyncs on gaps and persists periodic snapshots.
+    """
+
+    def __init__(self, snapshot_fetcher: Optional[Callable] = None, snapshot_interval_ms: Optional[int] = None,
+                 persist: Optional[Callable] = None, clock=time.time):
+        self._snapshot_fetcher = snapshot_fetcher or fetch_rest_depth_snapshot
+        self._snapshot_interval_ms = snapshot_interval_ms
+        self._persist = persist or self._persist_snapshot
+        self._clock = clock
+        self._books: Dict = {}
+        self._buffers: Dict = {}
+        self._last_persisted: Dict = {}
+        self._last_resync: Dict = {}
+        self._lock = threading.RLock()
+
+    @property
+    def snapshot_interval_ms(self) -> int:
+        return self._snapshot_interval_ms if self._snapshot_interval_ms is not None else get_snapshot_interval_ms()
+
+    def get_book(self, config_id) -> Optional[LocalOrderBook]:
+        return self._books.get(config_id)
+
+    def _book_for(self, config) -> LocalOrderBook:
+        book = self._books.get(config.id)
+        if book is None:
+            options = get_order_book_settings(config.data_source)
+            book = LocalOrderBook(
+                config.id,
+                max_levels=options['max_levels'],
+                checksum_fn=CHECKSUM_FUNCTIONS.get(options['checksum']) if options['checksum'] else None,
+                checksum_depth=int(options['checksum_depth']),
+            )
+            self._books[config.id] = book
+            self._buffers[config.id] = deque(maxlen=int(options['max_buffered_diffs']))
+        return book
+
+    def on_snapshot(self, config, event: Dict) -> LocalOrderBook:
+        with self._lock:
+            book = self._book_for(config)
+            book.load_snapshot(event.get('bids', []), event.get('asks', []), event.get('sequence'), event.get('timestamp'))
+            self._buffers[config.id].clear()
+            self._maybe_persist(config, book)
+            return book
+
+    def on_diff(self, config, event: Dict) -> LocalOrderBook:
+        with self._lock:
+            book = self._book_for(config)
+            if not book.is_synced:
+                # تا رسیدن snapshot، diffها بافر می‌شوند
+                self._buffers[config.id].append(event)
+                self.resync(config)
+                return book
+            try:
+                self._apply(book, event)
+            except (OrderBookSequenceGapError, OrderBookChecksumError) as e:
+                metrics.incr(f'{METRIC_PREFIX}.resyncs')
+                logger.warning(f"Order book for config {config.id} out of sync ({e}); resyncing.")
+                self._buffers[config.id].append(event)
+                self.resync(config)
+                return book
+            metrics.incr(f'{METRIC_PREFIX}.diffs')
+            self._maybe_persist(config, book)
+            return book
+
+    @staticmethod
+    def _apply(book: LocalOrderBook, event: Dict) -> bool:
+        return book.apply_diff(
+            event.get('bids', []), event.get('asks', []),
+            sequence=event.get('sequence'), first_sequence=event.get('first_sequence'),
+            checksum=event.get('checksum'), timestamp=event.get('timestamp'),
+        )
+
+    def resync(self, config) -> bool:
+        """
+        Reloads the book from a REST snapshot and replays buffered diffs newer than it.
+        """
+        with self._lock:
+            book = self._book_for(config)
+            now_ms = int(self._clock() * 1000)
+            cooldown_ms = int(get_order_book_settings(config.data_source)['resync_cooldown_ms'])
+            last = self._last_resync.get(config.id)
+            if last is not None and now_ms - last < cooldown_ms:
+                return False
+            self._last_resync[config.id] = now_ms
+            try:
+                snapshot = self._snapshot_fetcher(config)
+            except Exception as e:
+                logger.error(f"Failed to fetch order book snapshot for config {config.id}: {e}")
+                return False
+            if not snapshot:
+                return False
+            book.load_snapshot(snapshot.get('bids', []), snapshot.get('asks', []), snapshot.get('sequence'), snapshot.get('timestamp'))
+            buffered = list(self._buffers[config.id])
+            self._buffers[config.id].clear()
+            for event in buffered:
+                try:
+                    self._apply(book, event)
+                except (OrderBookSequenceGapError, OrderBookChecksumError) as e:
+                    # snapshot از diffهای بافرشده قدیمی‌تر است؛ منتظر diffهای بعدی می‌مانیم
+                    logger.warning(f"Buffered diffs do not continue snapshot for config {config.id}: {e}")
+                    return False
+            return True
+
+    def _maybe_persist(self, config, book: LocalOrderBook):
+        now_ms = int(self._clock() * 1000)
+        last = self._last_persisted.get(config.id)
+        if last is not None and now_ms - last < self.snapshot_interval_ms:
+            return
+        self._last_persisted[config.id] = now_ms
+        try:
+            self._persist(config, book)
+            metrics.incr(f'{METRIC_PREFIX}.snapshots_persisted')
+        except Exception as e:
+            logger.error(f"Failed to persist order book snapshot for config {config.id}: {e}")
+
+    @staticmethod
+    def _persist_snapshot(config, book: LocalOrderBook):
+        from .models import MarketDataOrderBook # Import داخل تابع برای جلوگیری از حلقه
+        from .storage import from_epoch_ms
+
+        snapshot = book.snapshot(depth=config.depth_levels)
+        timestamp_ms = snapshot['timestamp'] if snapshot['timestamp'] is not None else int(time.time() * 1000)
+        if getattr(config, 'use_binary_order_book', False):
+            from .order_book_codec import encode_for_config
+            MarketDataOrderBook.objects.create(
+                config=config,
+                timestamp=from_epoch_ms(timestamp_ms),
+                encoded_book=encode_for_config(config, snapshot['bids'], snapshot['asks'], timestamp_ms, snapshot['sequence']),
+                sequence=snapshot['sequence'],
+            )
+            return
+        MarketDataOrderBook.objects.create(
+            config=config,
+            timestamp=from_epoch_ms(timestamp_ms),
+            bids=snapshot['bids'],
+            asks=snapshot['asks'],
+            sequence=snapshot['sequence'],
+        )
+
+    def drop(self, config_id):
+        with self._lock:
+            self._books.pop(config_id, None)
+            self._buffers.pop(config_id, None)
+            self._last_persisted.pop(config_id, None)
+            self._last_resync.pop(config_id, None)
+
+
+# موتور سراسری در سطح پروسس
+order_book_engine = OrderBookEngine()
@@ -0,0 +1,251 @@
+# apps/market_data/order_book_codec.py
+
+"""
+Compact binary encoding of order book snapshots.
+
+Prices and quantities are stored as fixed-point int64 (multiples of the instrument's tick
+and lot size from InstrumentExchangeMap). Prices are delta-encoded from the best level
+outwards, so most deltas are a single tick, and the body is compressed with zstd or lz4
+when available (zlib otherwise). Decoding returns NumPy structured arrays directly.
+
+Layout: header struct HEADER (magic, version, compression, timestamp ms, sequence,
+price scale, quantity scale, bid count, ask count) followed by the compressed body
+[bid price deltas | bid quantities | ask price deltas | ask quantities] as little-endian int64.
+"""
+
+import logging
+import struct
+import threading
+import zlib
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from apps.core.fixed_point import FixedPointScale
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'OBK'
+VERSION = 1
+HEADER = struct.Struct('<3sBBqqddII')
+
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+COMPRESSION_ZSTD = 2
+COMPRESSION_LZ4 = 3
+COMPRESSION_NAMES = {
+    COMPRESSION_NONE: 'none',
+    COMPRESSION_ZLIB: 'zlib',
+    COMPRESSION_ZSTD: 'zstd',
+    COMPRESSION_LZ4: 'lz4',
+}
+
+# مقیاس پیش‌فرض وقتی tick/lot size در دسترس نیست یا داده روی شبکه آن نمی‌نشیند
+DEFAULT_SCALE = 1e-8
+NO_SEQUENCE = -1
+
+LEVEL_DTYPE = np.dtype([
+    ('price', '<f8'),
+    ('quantity', '<f8'),
+])
+
+try:
+    import zstandard
+except ImportError: # zstd اختیاری است
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError: # lz4 اختیاری است
+    lz4_frame = None
+
+
+def get_default_compression() -> int:
+    if zstandard is not None:
+        return COMPRESSION_ZSTD
+    if lz4_frame is not None:
+        return COMPRESSION_LZ4
+    return COMPRESSION_ZLIB
+
+
+def _compress(body: bytes, compression: int) -> bytes:
+    if compression == COMPRESSION_ZSTD:
+        return zstandard.ZstdCompressor(level=3).compress(body)
+    if compression == COMPRESSION_LZ4:
+        return lz4_frame.compress(body)
+    if compression == COMPRESSION_ZLIB:
+        return zlib.compress(body, 6)
+    return body
+
+
+def _decompress(body: bytes, compression: int) -> bytes:
+    if compression == COMPRESSION_ZSTD:
+        if zstandard is None:
+            raise ValueError("Order book was encoded with zstd but 'zstandard' is not installed.")
+        return zstandard.ZstdDecompressor().decompress(body)
+    if compression == COMPRESSION_LZ4:
+        if lz4_frame is None:
+            raise ValueError("Order book was encoded with lz4 but 'lz4' is not installed.")
+        return lz4_frame.decompress(body)
+    if compression == COMPRESSION_ZLIB:
+        return zlib.decompress(body)
+    return body
+
+
+def levels_to_array(levels) -> np.ndarray:
+    if isinstance(levels, np.ndarray) and levels.dtype == LEVEL_DTYPE:
+        return levels
+    array = np.empty(len(levels), dtype=LEVEL_DTYPE)
+    for index, (price, quantity) in enumerate(levels):
+        array[index] = (float(price), float(quantity))
+    return array
+
+
+def _choose_scale(values: np.ndarray, preferred: Optional[float]) -> float:
+    """
+    Returns preferred if every value is an exact multiple of it, otherwise DEFAULT_SCALE.
+    """
+    for scale in (preferred, DEFAULT_SCALE):
+        if not scale:
+            continue
+        units = np.rint(values / scale)
+        if np.all(np.abs(units * scale - values) <= np.abs(values) * 1e-12 + scale * 1e-6):
+            return float(scale)
+    return DEFAULT_SCALE
+
+
+def _from_units(units: np.ndarray, scale: float) -> np.ndarray:
+    # تقسیم بر معکوس صحیح مقیاس (مثلاً 100 برای 0.01) خطای ممیز شناور ضرب را ندارد
+    inverse = round(1.0 / scale)
+    if inverse >= 1 and abs(inverse * scale - 1.0) < 1e-12:
+        return units / float(inverse)
+    return units * scale
+
+
+class DecodedOrderBook:
+    """
+    Decoded snapshot: bids/asks are LEVEL_DTYPE structured arrays, best level first.
+    """
+    __slots__ = ('timestamp', 'sequence', 'bids', 'asks', 'price_scale', 'quantity_scale')
+
+    def __init__(self, timestamp, sequence, bids, asks, price_scale, quantity_scale):
+        self.timestamp = timestamp
+        self.sequence = sequence
+        self.bids = bids
+        self.asks = asks
+        self.price_scale = price_scale
+        self.quantity_scale = quantity_scale
+
+    def to_lists(self) -> Tuple[list, list]:
+        return self.bids.tolist(), self.asks.tolist()
+
+
+def encode_order_book(bids, asks, timestamp: int = 0, sequence: Optional[int] = None,
+                      tick_size: Optional[float] = None, lot_size: Optional[float] = None,
+                      compression: Optional[int] = None) -> bytes:
+    """
+    Encodes best-first bid/ask levels ([[price, qty], ...] or LEVEL_DTYPE arrays) to bytes.
+    """
+    bid_levels, ask_levels = levels_to_array(bids), levels_to_array(asks)
+    prices = np.concatenate((bid_levels['price'], ask_levels['price']))
+    quantities = np.concatenate((bid_levels['quantity'], ask_levels['quantity']))
+    price_scale = _choose_scale(prices, float(tick_size) if tick_size else None)
+    quantity_scale = _choose_scale(quantities, float(lot_size) if lot_size else None)
+
+    columns = []
+    for levels in (bid_levels, ask_levels):
+        price_units = np.rint(levels['price'] / price_scale).astype('<i8')
+        # دلتا از بهترین سطح به بیرون؛ اولین مقدار مطلق است
+        columns.append(np.diff(price_units, prepend=np.int64(0)).astype('<i8'))
+        columns.append(np.rint(levels['quantity'] / quantity_scale).astype('<i8'))
+    body = b''.join(column.tobytes() for column in columns)
+
+    compression = get_default_compression() if compression is None else compression
+    header = HEADER.pack(
+        MAGIC, VERSION, compression, int(timestamp or 0),
+        NO_SEQUENCE if sequence is None else int(sequence),
+        price_scale, quantity_scale, len(bid_levels), len(ask_levels),
+    )
+    return header + _compress(body, compression)
+
+
+def decode_order_book(blob: bytes) -> DecodedOrderBook:
+    blob = bytes(blob)
+    magic, version, compression, timestamp, sequence, price_scale, quantity_scale, n_bids, n_asks = HEADER.unpack_from(blob)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not an encoded order book (bad magic or version).")
+    body = np.frombuffer(_decompress(blob[HEADER.size:], compression), dtype='<i8')
+
+    sides = []
+    offset = 0
+    for count in (n_bids, n_asks):
+        price_deltas = body[offset:offset + count]
+        quantity_units = body[offset + count:offset + 2 * count]
+        offset += 2 * count
+        levels = np.empty(count, dtype=LEVEL_DTYPE)
+        levels['price'] = _from_units(np.cumsum(price_deltas), price_scale)
+        levels['quantity'] = _from_units(quantity_units, quantity_scale)
+        sides.append(levels)
+    return DecodedOrderBook(
+        timestamp, None if sequence == NO_SEQUENCE else sequence,
+        sides[0], sides[1], price_scale, quantity_scale,
+    )
+
+
+def get_compression_name(blob: bytes) -> str:
+    return COMPRESSION_NAMES.get(HEADER.unpack_from(bytes(blob))[2], 'unknown')
+
+
+# --- tick/lot size هر کانفیگ ---
+
+_scales_cache: Dict = {}
+_scales_lock = threading.Lock()
+
+
+def _config_steps(config) -> Tuple[FixedPointScale, Optional[float], Optional[float]]:
+    cached = _scales_cache.get(config.id)
+    if cached is not None:
+        return cached
+    from apps.instruments.models import InstrumentExchangeMap # Import داخل تابع برای جلوگیری از حلقه
+    from .streams import get_source_code
+
+    mapping = (
+        InstrumentExchangeMap.objects
+        .filter(instrument_id=config.instrument_id, exchange__code__iexact=get_source_code(config.data_source))
+        .values_list('tick_size', 'lot_size')
+        .first()
+    )
+    tick_size, lot_size = mapping or (None, None)
+    steps = (
+        FixedPointScale.from_steps(tick_size, lot_size),
+        float(tick_size) if tick_size else None,
+        float(lot_size) if lot_size else None,
+    )
+    with _scales_lock:
+        _scales_cache[config.id] = steps
+    return steps
+
+
+def get_fixed_point_scale(config) -> FixedPointScale:
+    """
+    FixedPointScale of the config's instrument on its exchange (8 decimals when unmapped), cached per config.
+    """
+    return _config_steps(config)[0]
+
+
+def get_order_book_scales(config) -> Tuple[Optional[float], Optional[float]]:
+    """
+    (tick_size, lot_size) of the config's instrument on its exchange, cached per config.
+    """
+    return _config_steps(config)[1:]
+
+
+def encode_for_config(config, bids, asks, timestamp: int = 0, sequence: Optional[int] = None) -> bytes:
+    tick_size, lot_size = get_order_book_scales(config)
+    return encode_order_book(bids, asks, timestamp=timestamp, sequence=sequence, tick_size=tick_size, lot_size=lot_size)
+
+
+def clear_scales_cache():
+    with _scales_lock:
+        _scales_cache.clear()
+
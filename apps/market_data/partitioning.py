@@ -0,0 +1,479 @@
+# apps/market_data/partitioning.py
+
+"""
+Time partitioning of the high-volume market data tables (snapshots, ticks, order books).
+
+On stock PostgreSQL each table is a native range-partitioned table on `timestamp` with one
+partition per day or month; PartitionManager creates future partitions ahead of time and
+enforces retention by detaching and dropping whole partitions instead of row deletes.
+With TimescaleDB the tables are hypertables instead: chunks are created automatically and
+retention uses drop_chunks. Queries filtering on config + timestamp are pruned to the
+partitions (chunks) covering the requested range.
+
+Retention is opt-in: nothing is dropped unless `retention_days` is configured for a model in
+settings.MARKET_DATA_PARTITIONING. Native tables also get a DEFAULT partition, so rows older
+than the oldest range partition (late backfills) can still be inserted.
+"""
+
+import logging
+import re
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from apps.core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+METRIC_PREFIX = 'market_data.partitions'
+
+INTERVAL_DAY = 'day'
+INTERVAL_MONTH = 'month'
+
+# retention_days=None: هیچ پارتیشنی حذف نمی‌شود مگر در settings برای همان مدل تنظیم شده باشد
+DEFAULT_PARTITIONING = {
+    'MarketDataSnapshot': {'interval': INTERVAL_MONTH, 'premake': 2, 'retention_days': None},
+    'MarketDataTick': {'interval': INTERVAL_DAY, 'premake': 3, 'retention_days': None},
+    'MarketDataOrderBook': {'interval': INTERVAL_DAY, 'premake': 3, 'retention_days': None},
+}
+
+PARTITIONED_MODELS = tuple(DEFAULT_PARTITIONING)
+
+
+def get_partitioning_settings(model_name: str) -> Dict:
+    """
+    Partitioning settings of a model: DEFAULT_PARTITIONING overridden by settings.MARKET_DATA_PARTITIONING.
+    """
+    overrides = getattr(settings, 'MARKET_DATA_PARTITIONING', {}) or {}
+    return {**DEFAULT_PARTITIONING[model_name], **overrides.get(model_name, {})}
+
+
+# --- محاسبه مرز پارتیشن‌ها ---
+
+def truncate_to_interval(value: datetime, interval: str) -> datetime:
+    value = value.astimezone(dt_timezone.utc)
+    if interval == INTERVAL_MONTH:
+        return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    return value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_boundary(start: datetime, interval: str) -> datetime:
+    if interval == INTERVAL_MONTH:
+        return start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+    return start + timedelta(days=1)
+
+
+def partition_name(table: str, start: datetime, interval: str) -> str:
+    suffix = start.strftime('%Y%m') if interval == INTERVAL_MONTH else start.strftime('%Y%m%d')
+    return f"{table}_p{suffix}"
+
+
+def default_partition_name(table: str) -> str:
+    return f"{table}_default"
+
+
+_BOUND_RE = re.compile(r"FROM \((.+?)\) TO \((.+?)\)")
+
+
+def _parse_bound_value(value: str) -> Optional[datetime]:
+    value = value.strip()
+    if value.upper() in ('MINVALUE', 'MAXVALUE'):
+        return None
+    parsed = datetime.fromisoformat(value.strip("'"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=dt_timezone.utc)
+    return parsed
+
+
+def parse_partition_bound(expression: str) -> Tuple[Optional[datetime], Optional[datetime]]:
+    """
+    (lower, upper) of a pg_get_expr(relpartbound) range; None stands for MINVALUE/MAXVALUE/DEFAULT.
+    """
+    match = _BOUND_RE.search(expression or '')
+    if match is None:
+        return None, None
+    return _parse_bound_value(match.group(1)), _parse_bound_value(match.group(2))
+
+
+class PartitionInfo:
+    __slots__ = ('name', 'lower', 'upper')
+
+    def __init__(self, name: str, lower: Optional[datetime], upper: Optional[datetime]):
+        self.name = name
+        self.lower = lower
+        self.upper = upper
+
+    @property
+    def is_default(self) -> bool:
+        # پارتیشن DEFAULT هیچ مرزی ندارد (پارتیشن legacy حداقل مرز بالا دارد)
+        return self.lower is None and self.upper is None
+
+    def __repr__(self):
+        return f"PartitionInfo({self.name!r}, {self.lower}, {self.upper})"
+
+
+def dropped_until(partitions: List[PartitionInfo]) -> Optional[datetime]:
+    """
+    Upper bound of the newest dropped range partition: every row before it is gone. Rows deleted
+    from the DEFAULT partition do not move this bound.
+    """
+    return max((info.upper for info in partitions if info.upper is not None), default=None)
+
+
+# --- بک‌اندهای پارتیشن‌بندی ---
+
+class NativePartitionBackend:
+    """
+    PostgreSQL declarative range partitioning on the `timestamp` column.
+    """
+    name = 'native'
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def _quote(self, name: str) -> str:
+        return self.connection.ops.quote_name(name)
+
+    def list_partitions(self, cursor, table: str) -> List[PartitionInfo]:
+        cursor.execute(
+            """
+            SELECT child.relname, pg_get_expr(child.relpartbound, child.oid)
+            FROM pg_inherits
+            JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE parent.relname = %s
+            """,
+            [table],
+        )
+        partitions = [PartitionInfo(name, *parse_partition_bound(bound)) for name, bound in cursor.fetchall()]
+        return sorted(partitions, key=lambda info: info.lower or datetime.min.replace(tzinfo=dt_timezone.utc))
+
+    def ensure_partitions(self, cursor, table: str, interval: str, premake: int, now: datetime) -> List[str]:
+        """
+        Creates the DEFAULT partition (if missing) and the partitions from the current period
+        up to `premake` periods ahead.
+        """
+        existing = self.list_partitions(cursor, table)
+        default = next((info.name for info in existing if info.is_default), None)
+        if default is None:
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {self._quote(default_partition_name(table))} "
+                f"PARTITION OF {self._quote(table)} DEFAULT"
+            )
+        covered_until = max((info.upper for info in existing if info.upper is not None), default=None)
+        # پارتیشن‌ها پشت سر هم ساخته می‌شوند تا بازه‌ها نه هم‌پوشانی و نه شکاف داشته باشند
+        start = covered_until if covered_until is not None else truncate_to_interval(now, interval)
+        horizon = truncate_to_interval(now, interval)
+        for _ in range(premake + 1):
+            horizon = next_boundary(horizon, interval)
+
+        created = []
+        while start < horizon:
+            end = next_boundary(start, interval)
+            name = partition_name(table, start, interval)
+            self._create_partition(cursor, table, name, start, end, default)
+            created.append(name)
+            start = end
+        return created
+
+    def _create_partition(self, cursor, table: str, name: str, start: datetime, end: datetime, default: Optional[str]):
+        if default is not None:
+            cursor.execute(
+                f"SELECT 1 FROM {self._quote(default)} WHERE {self._quote('timestamp')} >= %s "
+                f"AND {self._quote('timestamp')} < %s LIMIT 1",
+                [start, end],
+            )
+            if cursor.fetchone() is not None:
+                # ردیف‌های این بازه که در DEFAULT نشسته‌اند پیش از attach به پارتیشن جدید منتقل می‌شوند
+                cursor.execute(
+                    f"CREATE TABLE IF NOT EXISTS {self._quote(name)} "
+                    f"(LIKE {self._quote(table)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+                )
+                cursor.execute(
+                    f"WITH moved AS (DELETE FROM {self._quote(default)} WHERE {self._quote('timestamp')} >= %s "
+                    f"AND {self._quote('timestamp')} < %s RETURNING *) INSERT INTO {self._quote(name)} SELECT * FROM moved",
+                    [start, end],
+                )
+                cursor.execute(
+                    f"ALTER TABLE {self._quote(table)} ATTACH PARTITION {self._quote(name)} FOR VALUES FROM (%s) TO (%s)",
+                    [start, end],
+                )
+                return
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {self._quote(name)} PARTITION OF {self._quote(table)} "
+            f"FOR VALUES FROM (%s) TO (%s)",
+            [start, end],
+        )
+
+    def drop_expired(self, cursor, table: str, cutoff: datetime) -> List[PartitionInfo]:
+        """
+        Detaches and drops every partition whose whole range is older than cutoff. Rows of the
+        DEFAULT partition older than cutoff are deleted; it is listed when rows were removed.
+        """
+        dropped = []
+        for info in self.list_partitions(cursor, table):
+            if info.is_default:
+                cursor.execute(
+                    f"DELETE FROM {self._quote(info.name)} WHERE {self._quote('timestamp')} < %s", [cutoff]
+                )
+                if cursor.rowcount:
+                    dropped.append(info)
+                continue
+            if info.upper is None or info.upper > cutoff:
+                continue
+            cursor.execute(f"ALTER TABLE {self._quote(table)} DETACH PARTITION {self._quote(info.name)}")
+            cursor.execute(f"DROP TABLE {self._quote(info.name)}")
+            dropped.append(info)
+        return dropped
+
+    def convert(self, cursor, table: str, interval: str, premake: int, now: datetime):
+        """
+        Turns an existing plain table into a partitioned table. The old table is attached as
+        the first partition (MINVALUE up to the end of the period of its newest row), followed
+        by a DEFAULT partition.
+        """
+        legacy = f"{table}_legacy"
+        cursor.execute(f"ALTER TABLE {self._quote(table)} RENAME TO {self._quote(legacy)}")
+
+        cursor.execute(
+            """
+            SELECT con.conname FROM pg_constraint con JOIN pg_class rel ON rel.oid = con.conrelid
+            WHERE rel.relname = %s AND con.contype = 'p'
+            """,
+            [legacy],
+        )
+        primary_keys = [row[0] for row in cursor.fetchall()]
+        cursor.execute(
+            """
+            SELECT con.conname, pg_get_constraintdef(con.oid) FROM pg_constraint con
+            JOIN pg_class rel ON rel.oid = con.conrelid
+            WHERE rel.relname = %s AND con.contype = 'f'
+            """,
+            [legacy],
+        )
+        foreign_keys = cursor.fetchall()
+        cursor.execute(
+            """
+            SELECT idx.relname, pg_get_indexdef(idx.oid) FROM pg_index
+            JOIN pg_class idx ON idx.oid = pg_index.indexrelid
+            JOIN pg_class rel ON rel.oid = pg_index.indrelid
+            WHERE rel.relname = %s AND NOT pg_index.indisprimary
+            """,
+            [legacy],
+        )
+        indexes = cursor.fetchall()
+
+        for constraint in primary_keys:
+            cursor.execute(f"ALTER TABLE {self._quote(legacy)} DROP CONSTRAINT {self._quote(constraint)}")
+        for index_name, _ in indexes:
+            # نام اصلی ایندکس‌ها برای جدول پارتیشن‌شده (و migrationهای بعدی Django) آزاد می‌شود
+            cursor.execute(f"ALTER INDEX {self._quote(index_name)} RENAME TO {self._quote(index_name[:59] + '_old')}")
+
+        cursor.execute(
+            f"CREATE TABLE {self._quote(table)} (LIKE {self._quote(legacy)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) "
+            f"PARTITION BY RANGE ({self._quote('timestamp')})"
+        )
+        # کلید اصلی جدول پارتیشن‌شده باید ستون پارتیشن را شامل شود
+        cursor.execute(f"ALTER TABLE {self._quote(table)} ADD PRIMARY KEY (id, {self._quote('timestamp')})")
+        for constraint, definition in foreign_keys:
+            cursor.execute(f"ALTER TABLE {self._quote(table)} ADD CONSTRAINT {self._quote(constraint)} {definition}")
+        for _, definition in indexes:
+            cursor.execute(re.sub(r" ON (ONLY )?\S+ USING ", f" ON {self._quote(table)} USING ", definition, count=1))
+
+        cursor.execute(f"SELECT max({self._quote('timestamp')}) FROM {self._quote(legacy)}")
+        newest = cursor.fetchone()[0]
+        boundary = next_boundary(truncate_to_interval(max(filter(None, (newest, now))), interval), interval)
+        cursor.execute(
+            f"ALTER TABLE {self._quote(table)} ATTACH PARTITION {self._quote(legacy)} FOR VALUES FROM (MINVALUE) TO (%s)",
+            [boundary],
+        )
+        # پس از حذف پارتیشن legacy (retention)، درج داده‌های قدیمی در DEFAULT می‌نشیند
+        cursor.execute(f"CREATE TABLE {self._quote(default_partition_name(table))} PARTITION OF {self._quote(table)} DEFAULT")
+        self.ensure_partitions(cursor, table, interval, premake, now)
+
+
+class TimescalePartitionBackend:
+    """
+    TimescaleDB hypertables: chunks are created on insert, retention drops whole chunks.
+    """
+    name = 'timescale'
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def ensure_partitions(self, cursor, table: str, interval: str, premake: int, now: datetime) -> List[str]:
+        return [] # chunkها هنگام درج به صورت خودکار ساخته می‌شوند
+
+    def drop_expired(self, cursor, table: str, cutoff: datetime) -> List[PartitionInfo]:
+        # drop_chunks فقط chunkهایی را حذف می‌کند که کل بازه‌شان پیش از cutoff است
+        cursor.execute(
+            "SELECT chunk_schema || '.' || chunk_name, range_start, range_end FROM timescaledb_information.chunks "
+            "WHERE hypertable_name = %s AND range_end <= %s",
+            [table, cutoff],
+        )
+        expired = [PartitionInfo(name, lower, upper) for name, lower, upper in cursor.fetchall()]
+        cursor.execute("SELECT drop_chunks(%s::regclass, older_than => %s)", [table, cutoff])
+        return expired
+
+    def convert(self, cursor, table: str, interval: str, premake: int, now: datetime):
+        quote = self.connection.ops.quote_name
+        cursor.execute(
+            """
+            SELECT con.conname FROM pg_constraint con JOIN pg_class rel ON rel.oid = con.conrelid
+            WHERE rel.relname = %s AND con.contype = 'p'
+            """,
+            [table],
+        )
+        for (constraint,) in cursor.fetchall():
+            cursor.execute(f"ALTER TABLE {quote(table)} DROP CONSTRAINT {quote(constraint)}")
+        cursor.execute(f"ALTER TABLE {quote(table)} ADD PRIMARY KEY (id, {quote('timestamp')})")
+        cursor.execute(
+            "SELECT create_hypertable(%s::regclass, 'timestamp', chunk_time_interval => %s::interval, migrate_data => true)",
+            [table, '1 month' if interval == INTERVAL_MONTH else '1 day'],
+        )
+
+
+PARTITION_BACKENDS = {
+    NativePartitionBackend.name: NativePartitionBackend,
+    TimescalePartitionBackend.name: TimescalePartitionBackend,
+}
+
+
+def detect_partitioning(cursor, table: str) -> Optional[str]:
+    """
+    'timescale', 'native' or None (plain table) for an existing table.
+    """
+    cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'timescaledb'")
+    if cursor.fetchone() is not None:
+        cursor.execute("SELECT 1 FROM timescaledb_information.hypertables WHERE hypertable_name = %s", [table])
+        if cursor.fetchone() is not None:
+            return TimescalePartitionBackend.name
+    cursor.execute("SELECT 1 FROM pg_partitioned_table JOIN pg_class ON pg_class.oid = partrelid WHERE relname = %s", [table])
+    if cursor.fetchone() is not None:
+        return NativePartitionBackend.name
+    return None
+
+
+def choose_partition_backend(cursor, timescale_requested: bool) -> str:
+    """
+    Backend for converting plain tables, from settings.MARKET_DATA_PARTITION_BACKEND:
+    'native', 'timescale', or 'auto' (TimescaleDB when installed and a config asks for TIMESCALE storage).
+    """
+    configured = getattr(settings, 'MARKET_DATA_PARTITION_BACKEND', 'auto')
+    if configured != 'auto':
+        return configured
+    cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'timescaledb'")
+    if timescale_requested and cursor.fetchone() is not None:
+        return TimescalePartitionBackend.name
+    return NativePartitionBackend.name
+
+
+# --- مدیر پارتیشن‌ها ---
+
+class PartitionManager:
+    """
+    Creates partitions ahead of time and enforces retention for the partitioned market data models.
+    """
+
+    def __init__(self, using: str = 'default', clock=timezone.now):
+        self.using = using
+        self._clock = clock
+
+    @property
+    def connection(self):
+        return connections[self.using]
+
+    def is_supported(self) -> bool:
+        return self.connection.vendor == 'postgresql'
+
+    @staticmethod
+    def get_model(model_name: str):
+        from django.apps import apps # Import داخل تابع برای جلوگیری از حلقه
+        return apps.get_model('market_data', model_name)
+
+    def get_backend(self, cursor, table: str):
+        backend_name = detect_partitioning(cursor, table)
+        return PARTITION_BACKENDS[backend_name](self.connection) if backend_name else None
+
+    def convert_table(self, table: str, model_name: str, backend_name: str) -> bool:
+        """
+        Converts a plain table to the given backend; no-op if it is already partitioned.
+        """
+        if not self.is_supported():
+            return False
+        options = get_partitioning_settings(model_name)
+        with transaction.atomic(using=self.using), self.connection.cursor() as cursor:
+            if detect_partitioning(cursor, table) is not None:
+                return False
+            PARTITION_BACKENDS[backend_name](self.connection).convert(
+                cursor, table, options['interval'], options['premake'], self._clock(),
+            )
+        logger.info(f"Converted {table} to a {backend_name} partitioned table.")
+        return True
+
+    def ensure_partitions(self, model_name: str) -> List[str]:
+        if not self.is_supported():
+            return []
+        options = get_partitioning_settings(model_name)
+        table = self.get_model(model_name)._meta.db_table
+        with transaction.atomic(using=self.using), self.connection.cursor() as cursor:
+            backend = self.get_backend(cursor, table)
+            if backend is None:
+                return []
+            created = backend.ensure_partitions(cursor, table, options['interval'], options['premake'], self._clock())
+        metrics.gauge(f'{METRIC_PREFIX}.{table}.premade', len(created))
+        return created
+
+    def retention_cutoff(self, model_name: str, retention_days: Optional[int] = None) -> Optional[datetime]:
+        """
+        Timestamp before which rows of the model are expired; None when retention is disabled.
+        """
+        options = get_partitioning_settings(model_name)
+        days = options['retention_days'] if retention_days is None else retention_days
+        return self._clock() - timedelta(days=days) if days else None
+
+    def enforce_retention(self, model_name: str, retention_days: Optional[int] = None) -> Optional[List[PartitionInfo]]:
+        """
+        Drops the partitions older than the retention window and returns them. Returns None when
+        the table is not partitioned (the caller falls back to row deletes). Retention is
+        partition-granular: a partition is only dropped once its whole range is past the cutoff,
+        so rows up to dropped_until() are gone, not every row before the cutoff.
+        """
+        if not self.is_supported():
+            return None
+        cutoff = self.retention_cutoff(model_name, retention_days)
+        if cutoff is None:
+            return []
+        table = self.get_model(model_name)._meta.db_table
+        with transaction.atomic(using=self.using), self.connection.cursor() as cursor:
+            backend = self.get_backend(cursor, table)
+            if backend is None:
+                return None
+            dropped = backend.drop_expired(cursor, table, cutoff)
+        if dropped:
+            metrics.incr(f'{METRIC_PREFIX}.{table}.dropped', len(dropped))
+            logger.info(f"Dropped {len(dropped)} expired partitions of {table}: {', '.join(info.name for info in dropped)}")
+        return dropped
+
+    def maintain(self) -> Dict[str, Dict[str, List[str]]]:
+        """
+        Premakes future partitions and enforces retention for every partitioned model.
+        'dropped_until' is the bound before which the model's rows were dropped (or None).
+        """
+        report = {}
+        for model_name in PARTITIONED_MODELS:
+            created = self.ensure_partitions(model_name)
+            dropped = self.enforce_retention(model_name) or []
+            report[model_name] = {
+                'created': created,
+                'dropped': [info.name for info in dropped],
+                'dropped_until': dropped_until(dropped),
+            }
+        return report
+
+
+# مدیر سراسری پارتیشن‌ها در سطح پروسس
+partition_manager = PartitionManager()
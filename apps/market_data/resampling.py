@@ -0,0 +1,176 @@
+# apps/market_data/resampling.py
+
+import logging
+import re
+from typing import Optional
+
+import numpy as np
+
+from .storage import OHLCVArrays, COLUMNS
+
+logger = logging.getLogger(__name__)
+
+TIMEFRAME_PATTERN = re.compile(r'^(\d+)([smhdw])$')
+UNIT_MS = {
+    's': 1_000,
+    'm': 60_000,
+    'h': 3_600_000,
+    'd': 86_400_000,
+    'w': 7 * 86_400_000,
+}
+# epoch (1970-01-01) پنجشنبه است؛ کندل‌های هفتگی از دوشنبه 00:00 UTC شروع می‌شوند
+WEEK_ANCHOR_MS = 4 * 86_400_000
+
+ALIGNMENT_UTC = 'UTC'
+ALIGNMENT_EXCHANGE = 'EXCHANGE'
+
+
+def timeframe_to_ms(timeframe: str) -> int:
+    """
+    Converts a timeframe string ('1m', '4h', '1d', '1w', ...) to milliseconds.
+    """
+    match = TIMEFRAME_PATTERN.match(timeframe or '')
+    if not match:
+        raise ValueError(f"Invalid timeframe format: '{timeframe}'. Use e.g., '1m', '5m', '1h', '1d', '1w'.")
+    count, unit = match.groups()
+    if int(count) <= 0:
+        raise ValueError(f"Timeframe must be positive: '{timeframe}'.")
+    return int(count) * UNIT_MS[unit]
+
+
+def get_bucket_offset_ms(timeframe: str, alignment: str = ALIGNMENT_UTC, data_source=None) -> int:
+    """
+    Returns the bucket boundary offset (ms from epoch) for a target timeframe.
+    UTC alignment uses midnight UTC (Monday for weekly buckets). EXCHANGE alignment
+    additionally applies data_source.config['candle_offset_minutes'] (e.g. exchanges
+    that close daily candles at UTC+8).
+    """
+    offset = WEEK_ANCHOR_MS if timeframe.endswith('w') else 0
+    if alignment == ALIGNMENT_EXCHANGE and data_source is not None:
+        source_config = getattr(data_source, 'config', None) or {}
+        offset += int(source_config.get('candle_offset_minutes', 0)) * 60_000
+    elif alignment not in (ALIGNMENT_UTC, ALIGNMENT_EXCHANGE):
+        raise ValueError(f"Unsupported bucket alignment: '{alignment}'.")
+    return offset
+
+
+def bucket_starts(timestamps: np.ndarray, bucket_ms: int, offset_ms: int = 0) -> np.ndarray:
+    """
+    Maps epoch-ms timestamps to the start of their bucket (vectorized floor).
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    return (timestamps - offset_ms) // bucket_ms * bucket_ms + offset_ms
+
+
+def _sorted(arrays: OHLCVArrays) -> OHLCVArrays:
+    if len(arrays) < 2 or np.all(arrays.timestamp[1:] >= arrays.timestamp[:-1]):
+        return arrays
+    order = np.argsort(arrays.timestamp, kind='stable')
+    return OHLCVArrays(**{name: getattr(arrays, name)[order] for name in COLUMNS})
+
+
+def resample_ohlcv(arrays: OHLCVArrays, target_timeframe: str, offset_ms: int = 0) -> OHLCVArrays:
+    """
+    Aggregates candles into target_timeframe buckets in a single vectorized pass.
+    Output timestamps are bucket starts; only buckets that contain data are emitted.
+    """
+    if not len(arrays):
+        return OHLCVArrays.empty()
+    arrays = _sorted(arrays)
+    buckets = bucket_starts(arrays.timestamp, timeframe_to_ms(target_timeframe), offset_ms)
+
+    # اندیس شروع هر باکت (داده مرتب است، پس باکت‌ها پیوسته‌اند)
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(buckets)] - 1
+
+    return OHLCVArrays(
+        timestamp=buckets[starts],
+        open_price=np.asarray(arrays.open_price)[starts],
+        high_price=np.maximum.reduceat(np.asarray(arrays.high_price), starts),
+        low_price=np.minimum.reduceat(np.asarray(arrays.low_price), starts),
+        close_price=np.asarray(arrays.close_price)[ends],
+        volume=np.add.reduceat(_numeric(arrays.volume), starts),
+    )
+
+
+def _numeric(values) -> np.ndarray:
+    # آرایه‌های int64 ثابت‌نقطه (apps.core.fixed_point) بدون تبدیل به float تجمیع می‌شوند
+    values = np.asarray(values)
+    return values if values.dtype.kind in 'iu' else values.astype(np.float64, copy=False)
+
+
+def resample_ticks(timestamps, prices, quantities, target_timeframe: str, offset_ms: int = 0) -> OHLCVArrays:
+    """
+    Builds candles from raw ticks (epoch-ms timestamps, prices, quantities).
+    int64 fixed-point prices/quantities stay int64 (exact OHLC and volume sums).
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    prices = _numeric(prices)
+    quantities = _numeric(quantities)
+    ticks_as_bars = OHLCVArrays(
+        timestamp=timestamps,
+        open_price=prices,
+        high_price=prices,
+        low_price=prices,
+        close_price=prices,
+        volume=quantities,
+    )
+    return resample_ohlcv(ticks_as_bars, target_timeframe, offset_ms)
+
+
+class IncrementalResampler:
+    """
+    Streams source bars into a target timeframe. append() returns the buckets that
+    were completed by the new bars; the still-open bucket is kept in current_bucket.
+    """
+
+    def __init__(self, target_timeframe: str, offset_ms: int = 0, source_timeframe: Optional[str] = None):
+        self.target_timeframe = target_timeframe
+        self.bucket_ms = timeframe_to_ms(target_timeframe)
+        self.offset_ms = offset_ms
+        # با دانستن تایم‌فریم منبع، باکت به محض رسیدن آخرین کندل منبعش بسته می‌شود
+        self.source_ms = timeframe_to_ms(source_timeframe) if source_timeframe else None
+        self.current_bucket: Optional[OHLCVArrays] = None
+        self._last_source_ts: Optional[int] = None
+
+    def append(self, arrays: OHLCVArrays) -> OHLCVArrays:
+        if not len(arrays):
+            return OHLCVArrays.empty()
+        arrays = _sorted(arrays)
+
+        # کندل‌های قدیمی‌تر از باکت باز قابل افزودن نیستند (برای اصلاحات از re-rollup استفاده کنید)
+        if self.current_bucket is not None:
+            fresh = arrays.timestamp >= self.current_bucket.timestamp[0]
+            if not np.all(fresh):
+                logger.warning(f"IncrementalResampler({self.target_timeframe}) dropped {int((~fresh).sum())} out-of-order bars.")
+                arrays = OHLCVArrays(**{name: getattr(arrays, name)[fresh] for name in COLUMNS})
+                if not len(arrays):
+                    return OHLCVArrays.empty()
+
+        buckets = resample_ohlcv(arrays, self.target_timeframe, self.offset_ms)
+        if self.current_bucket is not None and buckets.timestamp[0] == self.current_bucket.timestamp[0]:
+            buckets = self._merge_into_first(buckets, self.current_bucket)
+        elif self.current_bucket is not None:
+            buckets = OHLCVArrays.concatenate([self.current_bucket, buckets])
+
+        self._last_source_ts = int(arrays.timestamp[-1])
+        last_index = len(buckets) - 1
+        if self._is_closed(int(buckets.timestamp[last_index])):
+            self.current_bucket = None
+            return buckets
+        self.current_bucket = OHLCVArrays(**{name: getattr(buckets, name)[last_index:].copy() for name in COLUMNS})
+        return OHLCVArrays(**{name: getattr(buckets, name)[:last_index] for name in COLUMNS})
+
+    def _is_closed(self, bucket_start: int) -> bool:
+        if self.source_ms is None or self._last_source_ts is None:
+            return False
+        return self._last_source_ts + self.source_ms >= bucket_start + self.bucket_ms
+
+    @staticmethod
+    def _merge_into_first(buckets: OHLCVArrays, pending: OHLCVArrays) -> OHLCVArrays:
+        columns = {name: np.array(getattr(buckets, name)) for name in COLUMNS}  # نوع ستون‌ها (float یا int64) حفظ می‌شود
+        columns['open_price'][0] = pending.open_price[0]
+        columns['high_price'][0] = max(columns['high_price'][0], pending.high_price[0])
+        columns['low_price'][0] = min(columns['low_price'][0], pending.low_price[0])
+        columns['volume'][0] += pending.volume[0]
+        return OHLCVArrays(**columns)
@@ -0,0 +1,393 @@
+# apps/market_data/rollups.py
+
+import logging
+import threading
+from contextlib import contextmanager
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+from django.conf import settings
+
+from apps.core.metrics import metrics
+from .resampling import bucket_starts, get_bucket_offset_ms, resample_ohlcv, timeframe_to_ms
+from .storage import (
+    OHLCVArrays,
+    ROW_DTYPE,
+    columnar_store,
+    from_epoch_ms,
+    load_ohlcv_arrays,
+    merge_records,
+    to_epoch_ms,
+)
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_SOURCE_TIMEFRAME = '1m'
+DEFAULT_ROLLUP_TIMEFRAMES = ('5m', '15m', '1h', '4h', '1d')
+METRIC_PREFIX = 'market_data.rollup'
+
+# فیلدهای وضعیت یک باکت باز؛ آخرین کندل منبع جدا نگه داشته می‌شود تا به‌روزرسانی‌های همان دقیقه O(1) باشند
+STATE_FIELDS = (
+    'bucket_start', 'first_ts', 'last_ts', 'open',
+    'prior_high', 'prior_low', 'prior_volume',
+    'last_open', 'last_high', 'last_low', 'last_close', 'last_volume',
+)
+INT_STATE_FIELDS = ('bucket_start', 'first_ts', 'last_ts')
+
+
+def get_rollup_timeframes() -> Iterable[str]:
+    return getattr(settings, 'MARKET_DATA_ROLLUP_TIMEFRAMES', DEFAULT_ROLLUP_TIMEFRAMES)
+
+
+def is_rollup_enabled() -> bool:
+    return getattr(settings, 'MARKET_DATA_ROLLUP_ENABLED', True)
+
+
+def get_lock_timeout_seconds() -> float:
+    return float(getattr(settings, 'MARKET_DATA_ROLLUP_LOCK_TIMEOUT_SECONDS', 30))
+
+
+def get_max_lateness_ms() -> int:
+    return int(getattr(settings, 'MARKET_DATA_ROLLUP_MAX_LATENESS_MINUTES', 24 * 60)) * 60_000
+
+
+def bucket_from_state(state: Dict) -> Dict:
+    """
+    Returns the OHLCV values of an open bucket state.
+    """
+    return {
+        'timestamp': state['bucket_start'],
+        'open': state['open'],
+        'high': max(state['prior_high'], state['last_high']),
+        'low': min(state['prior_low'], state['last_low']),
+        'close': state['last_close'],
+        'volume': state['prior_volume'] + state['last_volume'],
+    }
+
+
+# --- ذخیره‌سازی وضعیت باکت‌های باز ---
+
+class InMemoryRollupStateBackend:
+    """
+    Keeps open bucket states in process memory (single ingestion worker).
+    """
+
+    def __init__(self):
+        self._states: Dict[tuple, Dict] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def locked(self, config_id):
+        # یک پردازه: قفل موتور rollup کافی است
+        yield
+
+    def load(self, config_id, timeframes: List[str]) -> Dict[str, Optional[Dict]]:
+        with self._lock:
+            return {tf: (dict(self._states[(config_id, tf)]) if (config_id, tf) in self._states else None) for tf in timeframes}
+
+    def save(self, config_id, states: Dict[str, Optional[Dict]]):
+        with self._lock:
+            for tf, state in states.items():
+                if state is None:
+                    self._states.pop((config_id, tf), None)
+                else:
+                    self._states[(config_id, tf)] = dict(state)
+
+
+class RedisRollupStateBackend:
+    """
+    Keeps open bucket states in Redis hashes (shared by several ingestion workers).
+    All timeframes of a config are read and written in one pipeline; load-modify-save
+    runs under a per-config Redis lock so concurrent workers cannot overwrite each other.
+    """
+
+    def __init__(self, client=None):
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            import redis # Import داخل تابع؛ redis فقط برای این بک‌اند لازم است
+            self._client = redis.Redis(
+                host=getattr(settings, 'REDIS_HOST', 'localhost'),
+                port=getattr(settings, 'REDIS_PORT', 6379),
+                db=getattr(settings, 'REDIS_DB', 0),
+            )
+        return self._client
+
+    @staticmethod
+    def _key(config_id, timeframe: str) -> str:
+        return f"market_data:rollup:{config_id}:{timeframe}"
+
+    @contextmanager
+    def locked(self, config_id):
+        timeout = get_lock_timeout_seconds()
+        # انقضای قفل مانع قفل ماندن دائمی در صورت از کار افتادن worker می‌شود
+        lock = self.client.lock(f"market_data:rollup:{config_id}:lock", timeout=timeout, blocking_timeout=timeout)
+        if not lock.acquire():
+            metrics.incr(f'{METRIC_PREFIX}.lock_timeouts')
+            raise TimeoutError(f"Could not acquire rollup lock for config {config_id}")
+        try:
+            yield
+        finally:
+            try:
+                lock.release()
+            except Exception as e:
+                # قفل منقضی شده و ممکن است worker دیگری آن را گرفته باشد
+                logger.warning(f"Rollup lock for config {config_id} expired before release: {str(e)}")
+
+    def load(self, config_id, timeframes: List[str]) -> Dict[str, Optional[Dict]]:
+        pipe = self.client.pipeline(transaction=False)
+        for tf in timeframes:
+            pipe.hgetall(self._key(config_id, tf))
+        results = pipe.execute()
+        states = {}
+        for tf, raw in zip(timeframes, results):
+            if not raw:
+                states[tf] = None
+                continue
+            decoded = {k.decode() if isinstance(k, bytes) else k: v for k, v in raw.items()}
+            states[tf] = {
+                name: (int(decoded[name]) if name in INT_STATE_FIELDS else float(decoded[name]))
+                for name in STATE_FIELDS
+            }
+        return states
+
+    def save(self, config_id, states: Dict[str, Optional[Dict]]):
+        pipe = self.client.pipeline(transaction=False)
+        for tf, state in states.items():
+            key = self._key(config_id, tf)
+            pipe.delete(key)
+            if state is not None:
+                pipe.hset(key, mapping={name: repr(state[name]) for name in STATE_FIELDS})
+        pipe.execute()
+
+
+def get_rollup_state_backend():
+    backend = getattr(settings, 'MARKET_DATA_ROLLUP_BACKEND', 'memory')
+    if backend == 'redis':
+        return RedisRollupStateBackend()
+    return InMemoryRollupStateBackend()
+
+
+# --- موتور rollup ---
+
+class CandleRollupEngine:
+    """
+    Incrementally rolls closed 1m candles up into higher timeframe buckets.
+    Closed buckets are persisted; late or corrected candles re-roll only the affected buckets.
+    """
+
+    def __init__(self, state_backend=None, timeframes: Optional[Iterable[str]] = None, store=None):
+        self._state_backend = state_backend
+        self._timeframes = list(timeframes) if timeframes is not None else None
+        self.store = store or columnar_store
+        self._lock = threading.Lock()
+
+    @property
+    def state_backend(self):
+        if self._state_backend is None:
+            self._state_backend = get_rollup_state_backend()
+        return self._state_backend
+
+    @property
+    def timeframes(self) -> List[str]:
+        return self._timeframes if self._timeframes is not None else list(get_rollup_timeframes())
+
+    def process_snapshot(self, snapshot) -> List[Dict]:
+        """
+        Entry point used by snapshot ingestion (1m MarketDataSnapshot instance).
+        """
+        return self.process_candle(
+            snapshot.config,
+            {
+                'timestamp': to_epoch_ms(snapshot.timestamp),
+                'open': float(snapshot.open_price),
+                'high': float(snapshot.high_price),
+                'low': float(snapshot.low_price),
+                'close': float(snapshot.close_price),
+                'volume': float(snapshot.volume),
+            },
+        )
+
+    def process_candle(self, config, candle: Dict) -> List[Dict]:
+        """
+        Applies one source candle (epoch-ms timestamp, float OHLCV) to every rollup timeframe.
+        Returns the buckets that were closed and persisted by this candle.
+        """
+        timeframes = self.timeframes
+        ts = int(candle['timestamp'])
+        closed = []
+        with self._lock, self.state_backend.locked(config.id):
+            states = self.state_backend.load(config.id, timeframes)
+            for tf in timeframes:
+                offset_ms = get_bucket_offset_ms(tf, data_source=config.data_source)
+                bucket_start = int(bucket_starts([ts], timeframe_to_ms(tf), offset_ms)[0])
+                state = states.get(tf)
+
+                if state is None or bucket_start > state['bucket_start']:
+                    # باکت جدید: باکت باز قبلی بسته و ذخیره می‌شود
+                    if state is not None:
+                        bucket = bucket_from_state(state)
+                        self._persist_bucket(config, tf, bucket)
+                        closed.append({'timeframe': tf, **bucket})
+                    states[tf] = self._new_state(bucket_start, candle)
+                elif bucket_start < state['bucket_start']:
+                    # کندل دیرهنگام یا اصلاح‌شده برای باکتی که قبلاً بسته شده است
+                    self._rerollup_closed_bucket(config, tf, bucket_start, ts, state['last_ts'])
+                elif ts > state['last_ts']:
+                    states[tf] = self._fold_and_append(state, candle)
+                elif ts == state['last_ts']:
+                    states[tf] = self._replace_last(state, candle)
+                else:
+                    # کندل دیرهنگام داخل باکت باز: بازسازی باکت باز از داده منبع
+                    rebuilt = self._rebuild_open_state(config, tf, state)
+                    if rebuilt is not None:
+                        states[tf] = rebuilt
+            self.state_backend.save(config.id, states)
+
+        metrics.incr(f'{METRIC_PREFIX}.candles')
+        if closed:
+            metrics.incr(f'{METRIC_PREFIX}.buckets_closed', len(closed))
+        return closed
+
+    def get_open_buckets(self, config) -> Dict[str, Optional[Dict]]:
+        """
+        Returns the current (not yet closed) bucket for every rollup timeframe.
+        """
+        states = self.state_backend.load(config.id, self.timeframes)
+        return {tf: (bucket_from_state(state) if state else None) for tf, state in states.items()}
+
+    # --- تغییرات وضعیت ---
+    @staticmethod
+    def _new_state(bucket_start: int, candle: Dict) -> Dict:
+        ts = int(candle['timestamp'])
+        return {
+            'bucket_start': bucket_start,
+            'first_ts': ts,
+            'last_ts': ts,
+            'open': candle['open'],
+            'prior_high': float('-inf'),
+            'prior_low': float('inf'),
+            'prior_volume': 0.0,
+            'last_open': candle['open'],
+            'last_high': candle['high'],
+            'last_low': candle['low'],
+            'last_close': candle['close'],
+            'last_volume': candle['volume'],
+        }
+
+    @staticmethod
+    def _fold_and_append(state: Dict, candle: Dict) -> Dict:
+        state = dict(state)
+        state['prior_high'] = max(state['prior_high'], state['last_high'])
+        state['prior_low'] = min(state['prior_low'], state['last_low'])
+        state['prior_volume'] += state['last_volume']
+        state['last_ts'] = int(candle['timestamp'])
+        state['last_open'] = candle['open']
+        state['last_high'] = candle['high']
+        state['last_low'] = candle['low']
+        state['last_close'] = candle['close']
+        state['last_volume'] = candle['volume']
+        return state
+
+    @staticmethod
+    def _replace_last(state: Dict, candle: Dict) -> Dict:
+        state = dict(state)
+        if state['first_ts'] == state['last_ts']:
+            state['open'] = candle['open']
+        state['last_open'] = candle['open']
+        state['last_high'] = candle['high']
+        state['last_low'] = candle['low']
+        state['last_close'] = candle['close']
+        state['last_volume'] = candle['volume']
+        return state
+
+    # --- re-rollup محدود ---
+    def _load_source_bars(self, config, start_ms: int, end_ms: int) -> OHLCVArrays:
+        arrays = load_ohlcv_arrays(config, start_ms, end_ms, store=self.store)
+        # پایگاه داده ممکن است برای یک timestamp چند ردیف (اصلاح‌ها) داشته باشد؛ آخرین مقدار معتبر است
+        return OHLCVArrays.from_records(merge_records(arrays.to_records()))
+
+    def _rerollup_closed_bucket(self, config, timeframe: str, bucket_start: int, candle_ts: int, newest_ts: int):
+        # محدودیت: فقط اصلاحاتی که از آخرین کندل دریافتی خیلی عقب‌تر نیستند بازمحاسبه می‌شوند
+        if newest_ts - candle_ts > get_max_lateness_ms():
+            metrics.incr(f'{METRIC_PREFIX}.too_late')
+            logger.warning(f"Candle at {candle_ts} for config {config.id} is too late for {timeframe} re-rollup; left to materialize_timeframe_task.")
+            return
+
+        bucket_ms = timeframe_to_ms(timeframe)
+        source = self._load_source_bars(config, bucket_start, bucket_start + bucket_ms - 1)
+        rebuilt = resample_ohlcv(source, timeframe, get_bucket_offset_ms(timeframe, data_source=config.data_source))
+        if not len(rebuilt):
+            return
+        self._persist_bucket(config, timeframe, {
+            'timestamp': int(rebuilt.timestamp[0]),
+            'open': float(rebuilt.open_price[0]),
+            'high': float(rebuilt.high_price[0]),
+            'low': float(rebuilt.low_price[0]),
+            'close': float(rebuilt.close_price[0]),
+            'volume': float(rebuilt.volume[0]),
+        })
+        # باکت اصلاح‌شده: نتایج اندیکاتور وابسته به آن (و کندل‌های بعدی) باطل می‌شوند
+        from apps.core.cache import indicator_result_cache # Import داخل تابع برای جلوگیری از حلقه
+        indicator_result_cache.invalidate_series(config.instrument_id, timeframe, from_ts=int(rebuilt.timestamp[0]))
+        metrics.incr(f'{METRIC_PREFIX}.rerollups')
+        logger.info(f"Re-rolled {timeframe} bucket {bucket_start} for config {config.id} after a late/corrected candle.")
+
+    def _rebuild_open_state(self, config, timeframe: str, state: Dict) -> Optional[Dict]:
+        source = self._load_source_bars(config, state['bucket_start'], state['last_ts'])
+        if not len(source):
+            return None
+        rebuilt = None
+        for index in range(len(source)):
+            candle = {
+                'timestamp': int(source.timestamp[index]),
+                'open': float(source.open_price[index]),
+                'high': float(source.high_price[index]),
+                'low': float(source.low_price[index]),
+                'close': float(source.close_price[index]),
+                'volume': float(source.volume[index]),
+            }
+            rebuilt = self._new_state(state['bucket_start'], candle) if rebuilt is None else self._fold_and_append(rebuilt, candle)
+        metrics.incr(f'{METRIC_PREFIX}.rerollups')
+        return rebuilt
+
+    # --- ذخیره باکت بسته‌شده ---
+    def _persist_bucket(self, config, timeframe: str, bucket: Dict):
+        """
+        Persists a closed bucket to the columnar store (last write wins) and, if a
+        dedicated MarketDataConfig exists for the target timeframe, to MarketDataSnapshot.
+        """
+        record = np.array(
+            [(bucket['timestamp'], bucket['open'], bucket['high'], bucket['low'], bucket['close'], bucket['volume'])],
+            dtype=ROW_DTYPE,
+        )
+        self.store.append(config.id, timeframe, record)
+
+        from .models import MarketDataConfig, MarketDataSnapshot # Import داخل تابع برای جلوگیری از حلقه
+        target_config = MarketDataConfig.objects.filter(
+            instrument_id=config.instrument_id,
+            data_source_id=config.data_source_id,
+            timeframe=timeframe,
+            data_type='OHLCV',
+        ).first()
+        if target_config is None:
+            return
+        MarketDataSnapshot.objects.update_or_create(
+            config=target_config,
+            timestamp=from_epoch_ms(bucket['timestamp']),
+            defaults={
+                'open_price': Decimal(str(bucket['open'])),
+                'high_price': Decimal(str(bucket['high'])),
+                'low_price': Decimal(str(bucket['low'])),
+                'close_price': Decimal(str(bucket['close'])),
+                'volume': Decimal(str(bucket['volume'])),
+                'additional_data': {'rollup_source_config': str(config.id)},
+            },
+        )
+
+
+# موتور سراسری در سطح پروسس (بک‌اند وضعیت از settings.MARKET_DATA_ROLLUP_BACKEND)
+candle_rollup_engine = CandleRollupEngine()
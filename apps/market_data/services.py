@@ -17,7 +17,16 @@ from .models import (
 )
 from .exceptions import DataSyncError, DataFetchError, DataProcessingError # فرض بر این است که این استثناها وجود دارند
 from .helpers import normalize_data_from_source, validate_ohlcv_data # فرض بر این است که این توابع کمکی وجود دارند
+from .ingestion import get_tick_batching_settings, tick_ingestion_buffer
+from .storage import columnar_store, is_columnar_store_enabled, to_epoch_ms
+from .rollups import ROLLUP_SOURCE_TIMEFRAME, candle_rollup_engine, is_rollup_enabled
+from .order_book import order_book_engine
+from .hot_cache import hot_market_cache
+from .coverage import get_coverage_report, record_bars
+from .serializers import MarketDataSnapshotSerializer
 from .tasks import fetch_and_store_historical_data_task, process_tick_data_task # فرض بر این است که این تاسک‌ها وجود دارند
+from apps.instruments.indicator_engine import indicator_engine
+from apps.core.cache import indicator_result_cache
 from apps.connectors.service import ConnectorService # فرض بر این است که این سرویس برای اتصال به APIها وجود دارد
 from apps.core.encryption import decrypt_field # فرض بر این است که این تابع برای رمزنگاری کلیدها وجود دارد
 
@@ -57,11 +66,52 @@ class MarketDataService:
             raise DataSyncError(f"Failed to trigger sync for config {config.id}: {str(e)}")
 
 
+    @staticmethod
+    def trigger_backfill(config: MarketDataConfig, start=None, end=None, fill_gaps: bool = False) -> MarketDataSyncLog:
+        """
+        Starts a (resumable) backfill of a config's candles over [start, end) in a Celery task.
+        """
+        from .tasks import backfill_historical_data_task # Import داخل تابع برای جلوگیری از حلقه
+        try:
+            now = timezone.now()
+            sync_log = MarketDataSyncLog.objects.create(
+                config=config,
+                start_time=now,
+                end_time=now,
+                status='PARTIAL',
+                details={'triggered_by': 'backfill', 'fill_gaps': fill_gaps},
+            )
+            backfill_historical_data_task.delay(
+                config.id, sync_log.id,
+                to_epoch_ms(start) if start is not None else None,
+                to_epoch_ms(end) if end is not None else None,
+                fill_gaps,
+            )
+            logger.info(f"Backfill task triggered for config {config.id} via service.")
+            return sync_log
+        except Exception as e:
+            logger.error(f"Error triggering backfill for config {config.id} in service: {str(e)}")
+            raise DataSyncError(f"Failed to trigger backfill for config {config.id}: {str(e)}")
+
+
+    @staticmethod
+    def get_data_coverage(config: MarketDataConfig, start, end, limit: int = 100) -> dict:
+        """
+        Coverage report (expected/missing bars and missing ranges) of a config over [start, end).
+        """
+        try:
+            return get_coverage_report(config, start, end, limit=limit)
+        except Exception as e:
+            logger.error(f"Error building coverage report for config {config.id}: {str(e)}")
+            raise DataProcessingError(f"Failed to build coverage report for config {config.id}: {str(e)}")
+
     @staticmethod
     def process_received_tick_data(config: MarketDataConfig, raw_tick_data: dict):
         """
         Processes a single tick of data received from an agent or WebSocket.
         Validates, normalizes, saves, and potentially triggers downstream actions.
+        If tick batching is enabled for the data source, the tick is buffered and
+        written in bulk by the config's TickBatcher instead.
         """
         try:
             # 1. نرمالایز کردن داده
@@ -76,16 +126,23 @@ class MarketDataService:
                 logger.warning(f"Normalized tick data failed validation for config {config.id}. Normalized data: {normalized_tick}")
                 return
 
+            tick_row = {
+                'timestamp': timezone.make_aware(datetime.fromtimestamp(validated_tick['timestamp'])),
+                'price': Decimal(str(validated_tick['price'])),
+                'quantity': Decimal(str(validated_tick['quantity'])),
+                'side': validated_tick['side'],
+                'trade_id': validated_tick.get('trade_id', None),
+            }
+
+            # 3. حالت بافر: تیک در micro-batcher کانفیگ قرار می‌گیرد و با bulk_create ذخیره می‌شود
+            batching_settings = get_tick_batching_settings(config.data_source)
+            if batching_settings['enabled']:
+                tick_ingestion_buffer.submit(config, tick_row, batching_settings)
+                return
+
             # 3. ذخیره در مدل MarketDataTick
             with transaction.atomic(): # برای اطمینان از یکپارچگی
-                tick_obj = MarketDataTick.objects.create(
-                    config=config,
-                    timestamp=timezone.make_aware(datetime.fromtimestamp(validated_tick['timestamp'])),
-                    price=Decimal(str(validated_tick['price'])),
-                    quantity=Decimal(str(validated_tick['quantity'])),
-                    side=validated_tick['side'],
-                    trade_id=validated_tick.get('trade_id', None)
-                )
+                tick_obj = MarketDataTick.objects.create(config=config, **tick_row)
 
             logger.info(f"Processed and saved tick data for {config.instrument.symbol} (ID: {config.id}). Timestamp: {tick_obj.timestamp}")
 
@@ -119,27 +176,29 @@ class MarketDataService:
                 logger.warning(f"Normalized snapshot data failed validation for config {config.id}. Normalized data: {normalized_snapshot}")
                 return
 
-            # 3. ذخیره در مدل MarketDataSnapshot
+            # 3. ذخیره در مدل MarketDataSnapshot (upsert روی (config, timestamp)؛ به‌روزرسانی‌های کندل باز همان ردیف را بازنویسی می‌کنند)
             with transaction.atomic():
-                snapshot_obj = MarketDataSnapshot.objects.create(
+                snapshot_obj, _ = MarketDataSnapshot.objects.update_or_create(
                     config=config,
                     timestamp=timezone.make_aware(datetime.fromtimestamp(validated_snapshot['timestamp'])),
-                    open_price=Decimal(str(validated_snapshot['open'])),
-                    high_price=Decimal(str(validated_snapshot['high'])),
-                    low_price=Decimal(str(validated_snapshot['low'])),
-                    close_price=Decimal(str(validated_snapshot['close'])),
-                    volume=Decimal(str(validated_snapshot['volume'])),
-                    best_bid=Decimal(str(validated_snapshot.get('best_bid', 0))) if validated_snapshot.get('best_bid') else None,
-                    best_ask=Decimal(str(validated_snapshot.get('best_ask', 0))) if validated_snapshot.get('best_ask') else None,
-                    bid_size=Decimal(str(validated_snapshot.get('bid_size', 0))) if validated_snapshot.get('bid_size') else None,
-                    ask_size=Decimal(str(validated_snapshot.get('ask_size', 0))) if validated_snapshot.get('ask_size') else None,
-                    additional_data=validated_snapshot.get('additional_data', {})
+                    defaults=dict(
+                        open_price=Decimal(str(validated_snapshot['open'])),
+                        high_price=Decimal(str(validated_snapshot['high'])),
+                        low_price=Decimal(str(validated_snapshot['low'])),
+                        close_price=Decimal(str(validated_snapshot['close'])),
+                        volume=Decimal(str(validated_snapshot['volume'])),
+                        best_bid=Decimal(str(validated_snapshot.get('best_bid', 0))) if validated_snapshot.get('best_bid') else None,
+                        best_ask=Decimal(str(validated_snapshot.get('best_ask', 0))) if validated_snapshot.get('best_ask') else None,
+                        bid_size=Decimal(str(validated_snapshot.get('bid_size', 0))) if validated_snapshot.get('bid_size') else None,
+                        ask_size=Decimal(str(validated_snapshot.get('ask_size', 0))) if validated_snapshot.get('ask_size') else None,
+                        additional_data=validated_snapshot.get('additional_data', {}),
+                    ),
                 )
 
             logger.info(f"Processed and saved snapshot data for {config.instrument.symbol} (ID: {config.id}). Timestamp: {snapshot_obj.timestamp}")
 
-            # 4. بروزرسانی کش (اختیاری)
-            MarketDataService.update_cache_for_config(config, validated_snapshot)
+            # پردازش‌های پس از ذخیره (ایندکس پوشش، ذخیره‌ساز ستونی، rollup، اندیکاتورها، کش)
+            MarketDataService.run_snapshot_hooks(config, [snapshot_obj])
 
         except ValidationError as ve:
             logger.error(f"Validation error processing snapshot for config {config.id}: {ve}")
@@ -149,6 +208,71 @@ class MarketDataService:
             raise DataProcessingError(f"Failed to process snapshot: {str(e)}")
 
 
+    @staticmethod
+    def run_snapshot_hooks(config: MarketDataConfig, snapshots, update_hot_cache: bool = True):
+        """
+        Post-persist hooks for saved snapshots of one config: coverage index, columnar store,
+        1m rollups, streaming indicators, indicator result cache and (optionally) the hot cache.
+        Shared by single upserts, backfill pages and the agent's bulk writer; snapshots are
+        applied in timestamp order.
+        """
+        snapshots = sorted(snapshots, key=lambda snapshot: snapshot.timestamp)
+        if not snapshots:
+            return
+
+        # به‌روزرسانی افزایشی ایندکس پوشش سری (تشخیص شکاف بدون اسکن جدول)
+        try:
+            record_bars(config, [snapshot.timestamp for snapshot in snapshots])
+        except Exception as e:
+            logger.error(f"Error updating coverage index for config {config.id}: {str(e)}")
+
+        # افزودن کندل‌های بسته‌شده به ذخیره‌ساز ستونی (برای بک‌تست و اندیکاتورها)
+        if is_columnar_store_enabled():
+            try:
+                columnar_store.append_closed_snapshots(config, snapshots)
+            except Exception as e:
+                logger.error(f"Error appending snapshots to columnar store for config {config.id}: {str(e)}")
+
+        rollup = is_rollup_enabled() and config.timeframe == ROLLUP_SOURCE_TIMEFRAME
+        for snapshot in snapshots:
+            candle = {
+                'timestamp': to_epoch_ms(snapshot.timestamp),
+                'open': float(snapshot.open_price),
+                'high': float(snapshot.high_price),
+                'low': float(snapshot.low_price),
+                'close': float(snapshot.close_price),
+                'volume': float(snapshot.volume),
+            }
+
+            # به‌روزرسانی باکت‌های باز تایم‌فریم‌های بالاتر (5m/15m/1h/4h/1d) از کندل 1m
+            closed_buckets = []
+            if rollup:
+                try:
+                    closed_buckets = candle_rollup_engine.process_candle(config, candle)
+                except Exception as e:
+                    logger.error(f"Error rolling up snapshot for config {config.id}: {str(e)}")
+
+            # به‌روزرسانی افزایشی اندیکاتورهای ردیابی‌شده برای این سری (و باکت‌های بسته‌شده)
+            try:
+                indicator_engine.on_candle(config.instrument_id, config.timeframe, candle)
+                for bucket in closed_buckets:
+                    indicator_engine.on_candle(config.instrument_id, bucket['timeframe'], bucket)
+            except Exception as e:
+                logger.error(f"Error updating indicators for config {config.id}: {str(e)}")
+
+            # ابطال نتایج کش‌شده اندیکاتور فقط برای سری‌های متأثر (کندل جدید یا اصلاح‌شده)
+            indicator_result_cache.on_bar(config.instrument_id, config.timeframe, candle['timestamp'])
+            for bucket in closed_buckets:
+                indicator_result_cache.on_bar(config.instrument_id, bucket['timeframe'], bucket['timestamp'])
+
+        # فقط جدیدترین کندل در کش داغ قرار می‌گیرد
+        if update_hot_cache:
+            try:
+                MarketDataService.cache_snapshot(snapshots[-1])
+            except Exception as e:
+                logger.error(f"Error updating hot cache for config {config.id}: {str(e)}")
+
+
     @staticmethod
     def process_received_orderbook_data(config: MarketDataConfig, raw_orderbook_data: dict):
         """
@@ -174,21 +298,33 @@ class MarketDataService:
                  logger.warning(f"Invalid order book format (bids/asks not lists) for config {config.id}. Normalized data: {normalized_book}")
                  return
 
-            # 3. ذخیره در مدل MarketDataOrderBook
-            with transaction.atomic():
-                book_obj = MarketDataOrderBook.objects.create(
-                    config=config,
-                    timestamp=timezone.make_aware(datetime.fromtimestamp(normalized_book['timestamp'])),
-                    bids=bids,
-                    asks=asks,
-                    sequence=sequence,
-                    checksum=checksum
-                )
-
-            logger.info(f"Processed and saved order book data for {config.instrument.symbol} (ID: {config.id}). Timestamp: {book_obj.timestamp}")
-
-            # 4. بروزرسانی کش (اختیاری)
-            MarketDataService.update_cache_for_config(config, normalized_book, data_type='ORDER_BOOK')
+            # 3. اعمال روی دفتر سفارش محلی؛ فقط snapshotهای دوره‌ای در MarketDataOrderBook ذخیره می‌شوند
+            event = {
+                'bids': bids,
+                'asks': asks,
+                'sequence': sequence,
+                'first_sequence': normalized_book.get('first_sequence'),
+                'checksum': checksum,
+                'timestamp': normalized_book.get('timestamp'),
+            }
+            if event['first_sequence'] is not None:
+                book = order_book_engine.on_diff(config, event)
+            else:
+                book = order_book_engine.on_snapshot(config, event)
+
+            if book.is_synced:
+                # 4. بروزرسانی کش با خلاصه بالای دفتر (اختیاری)
+                MarketDataService.update_cache_for_config(config, {
+                    'timestamp': book.timestamp,
+                    'sequence': book.sequence,
+                    'best_bid': book.best_bid(),
+                    'best_ask': book.best_ask(),
+                    'microprice': book.microprice(),
+                    'imbalance': book.imbalance(5),
+                }, data_type='ORDER_BOOK')
+                if config.use_binary_order_book:
+                    # 5. کش و fan-out باینری (کدک order_book_codec به جای JSON)
+                    MarketDataService.publish_binary_order_book(config, book)
 
         except ValidationError as ve:
             logger.error(f"Validation error processing order book for config {config.id}: {ve}")
@@ -199,45 +335,116 @@ class MarketDataService:
 
 
     @staticmethod
-    def update_cache_for_config(config: MarketDataConfig, data: dict, data_type: str = 'OHLCV'):
+    def binary_order_book_cache_key(config_id) -> str:
+        return f"order_book_binary_{config_id}"
+
+    @staticmethod
+    def publish_binary_order_book(config: MarketDataConfig, book):
         """
-        Updates the cache entry for a specific config with the latest data point.
+        Encodes the top config.depth_levels of a local book once and uses the same bytes
+        for the cache and the channel-layer fan-out.
         """
+        from django.core.cache import cache
+        from .order_book_codec import encode_for_config
+        from .streams import get_source_code
+
+        snapshot = book.snapshot(depth=config.depth_levels)
+        payload = encode_for_config(config, snapshot['bids'], snapshot['asks'], snapshot['timestamp'] or 0, snapshot['sequence'])
+        cache.set(MarketDataService.binary_order_book_cache_key(config.id), payload, timeout=60)
         try:
-            cache_entry, created = MarketDataCache.objects.get_or_create(
-                config=config,
-                defaults={'latest_snapshot': data, 'cached_at': timezone.now()}
-            )
-            if not created:
-                cache_entry.latest_snapshot = data
-                cache_entry.cached_at = timezone.now()
-                cache_entry.save(update_fields=['latest_snapshot', 'cached_at'])
+            from asgiref.sync import async_to_sync
+            from channels.layers import get_channel_layer
+            channel_layer = get_channel_layer()
+            if channel_layer is not None:
+                group_name = f"market_data.{get_source_code(config.data_source)}.{config.instrument.symbol}.depth"
+                async_to_sync(channel_layer.group_send)(group_name, {'type': 'order_book.update', 'payload': payload})
+        except Exception as e:
+            logger.error(f"Error publishing binary order book for config {config.id}: {str(e)}")
+        return payload
+
+    @staticmethod
+    def get_binary_order_book(config_id):
+        """
+        Latest cached binary order book of a config, decoded to structured arrays (or None).
+        """
+        from django.core.cache import cache
+        from .order_book_codec import decode_order_book
+
+        payload = cache.get(MarketDataService.binary_order_book_cache_key(config_id))
+        return decode_order_book(payload) if payload is not None else None
 
-            logger.debug(f"Cache updated for config {config.id} with data type {data_type}.")
+    @staticmethod
+    def update_cache_for_config(config: MarketDataConfig, data: dict, data_type: str = 'OHLCV'):
+        """
+        Updates the hot market state of a config with the latest data point.
+        The MarketDataCache table is only written by checkpoint_market_state_task.
+        """
+        try:
+            hot_market_cache.update(config, data_type, data)
+            logger.debug(f"Hot cache updated for config {config.id} with data type {data_type}.")
         except Exception as e:
             logger.error(f"Error updating cache for config {config.id}: {str(e)}")
             # این خطا ممکن است نادیده گرفته شود یا به روشی دیگر مدیریت شود، چون کش اختیاری است
 
+    @staticmethod
+    def cache_snapshot(snapshot: MarketDataSnapshot):
+        """
+        Puts a saved snapshot into the hot cache in the MarketDataSnapshotSerializer shape,
+        so cached and database reads of the latest candle return the same JSON.
+        """
+        MarketDataService.update_cache_for_config(
+            snapshot.config, MarketDataSnapshotSerializer(snapshot).data, data_type='OHLCV'
+        )
+
+    @staticmethod
+    def checkpoint_market_state() -> int:
+        """
+        Writes the hot state of configs changed since the last checkpoint to MarketDataCache.
+        """
+        dirty = hot_market_cache.pop_dirty()
+        if not dirty:
+            return 0
+        snapshots = hot_market_cache.snapshot_for_checkpoint(dirty)
+        now = timezone.now()
+        existing = {
+            str(entry.config_id): entry
+            for entry in MarketDataCache.objects.filter(config_id__in=list(snapshots))
+        }
+        valid_ids = {
+            str(config_id)
+            for config_id in MarketDataConfig.objects.filter(id__in=list(snapshots)).values_list('id', flat=True)
+        }
+        to_update, to_create = [], []
+        for config_id, snapshot in snapshots.items():
+            entry = existing.get(config_id)
+            if entry is not None:
+                entry.latest_snapshot = snapshot
+                entry.cached_at = now
+                to_update.append(entry)
+            elif config_id in valid_ids:
+                # کانفیگ‌های حذف‌شده (که هنوز در کش داغ هستند) نادیده گرفته می‌شوند
+                to_create.append(MarketDataCache(config_id=config_id, latest_snapshot=snapshot, cached_at=now))
+        with transaction.atomic():
+            if to_update:
+                MarketDataCache.objects.bulk_update(to_update, ['latest_snapshot', 'cached_at'])
+            if to_create:
+                MarketDataCache.objects.bulk_create(to_create, ignore_conflicts=True)
+        logger.debug(f"Checkpointed hot market state of {len(to_update) + len(to_create)} configs.")
+        return len(to_update) + len(to_create)
 
     @staticmethod
     def get_latest_snapshot_for_instrument(symbol: str, timeframe: str):
         """
         Retrieves the latest snapshot for a given instrument symbol and timeframe.
-        Uses cache if available, otherwise queries the database.
+        Uses the hot market cache if available, otherwise queries the database.
         """
         try:
-            # 1. تلاش برای گرفتن از کش
-            try:
-                config = MarketDataConfig.objects.get(
-                    instrument__symbol__iexact=symbol,
-                    timeframe__iexact=timeframe
-                )
-                cache_entry = MarketDataCache.objects.get(config=config)
-                logger.debug(f"Cache hit for {symbol} ({timeframe}).")
-                return cache_entry.latest_snapshot
-            except (MarketDataConfig.DoesNotExist, MarketDataCache.DoesNotExist):
-                logger.debug(f"Cache miss for {symbol} ({timeframe}), querying DB.")
-                pass # ادامه دهید به کوئری پایگاه داده
+            # 1. تلاش برای گرفتن از کش داغ (بدون مراجعه به پایگاه داده)
+            candle = hot_market_cache.get_latest_candle(symbol, timeframe)
+            if candle is not None:
+                logger.debug(f"Hot cache hit for {symbol} ({timeframe}).")
+                return candle
+            logger.debug(f"Cache miss for {symbol} ({timeframe}), querying DB.")
 
             # 2. کوئری پایگاه داده
             latest_snapshot = MarketDataSnapshot.objects.filter(
@@ -125,18 +125,9 @@ def handle_market_data_snapshot_save(sender, instance, created, **kwargs):
     if created:
         logger.info(f"New MarketDataSnapshot saved for {instance.config.instrument.symbol} at {instance.timestamp}.")
 
-        # مثال: بروزرسانی کش
+        # مثال: بروزرسانی کش (هم‌شکل خروجی MarketDataSnapshotSerializer)
         from .services import MarketDataService
-        latest_data_dict = {
-            'timestamp': instance.timestamp.timestamp(),
-            'open': float(instance.open_price),
-            'high': float(instance.high_price),
-            'low': float(instance.low_price),
-            'close': float(instance.close_price),
-            'volume': float(instance.volume),
-            # سایر فیلدها اگر نیاز باشد
-        }
-        MarketDataService.update_cache_for_config(instance.config, latest_data_dict, data_type='OHLCV')
+        MarketDataService.cache_snapshot(instance)
 
         # مثال: فعال‌سازی تاسک تحلیل بلادرنگ (مثلاً بررسی الگوی قیمتی، ایجاد سیگنال)
         # from apps.analysis.tasks import analyze_snapshot_task
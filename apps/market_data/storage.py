@@ -0,0 +1,559 @@
+# apps/market_data/storage.py
+
+import logging
+import os
+import struct
+import threading
+import time
+from bisect import bisect_right
+from contextlib import contextmanager
+from datetime import datetime, timezone as dt_timezone
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError: # ویندوز
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# --- قالب فایل ---
+# هر پارتیشن (config, timeframe, ماه) یک فایل ستونی فشرده‌شده (.ohlcv) دارد:
+#   هدر 32 بایتی + ستون‌های پیوسته timestamp(int64, ms) | open | high | low | close | volume (float64)
+# افزودن‌های جدید ابتدا در ژورنال (.log) به صورت رکورد سطری نوشته می‌شوند و compaction آن‌ها را در فایل ستونی ادغام می‌کند.
+MAGIC = b'OHLCVCOL'
+FORMAT_VERSION = 1
+HEADER_STRUCT = struct.Struct('<8sIIq8x')  # magic, version, column_count, row_count, padding
+HEADER_SIZE = HEADER_STRUCT.size
+
+COLUMNS = ('timestamp', 'open_price', 'high_price', 'low_price', 'close_price', 'volume')
+COLUMN_DTYPES = {
+    'timestamp': np.dtype('<i8'),
+    'open_price': np.dtype('<f8'),
+    'high_price': np.dtype('<f8'),
+    'low_price': np.dtype('<f8'),
+    'close_price': np.dtype('<f8'),
+    'volume': np.dtype('<f8'),
+}
+ROW_DTYPE = np.dtype([(name, COLUMN_DTYPES[name]) for name in COLUMNS])
+
+COLUMNAR_SUFFIX = '.ohlcv'
+JOURNAL_SUFFIX = '.log'
+
+# متادیتای هر (config, timeframe): قدیمی‌ترین و جدیدترین timestamp ذخیره‌شده، بدون نیاز به خواندن پارتیشن‌ها
+BOUNDS_NAME = 'bounds'
+BOUNDS_SUFFIX = '.meta'
+BOUNDS_STRUCT = struct.Struct('<qq')  # first_ms, last_ms
+
+# حفره‌های بیش از این تعداد با یک کوئری پوشاننده از دیتابیس خوانده می‌شوند
+MAX_HOLE_QUERIES = 8
+
+
+def get_columnar_root() -> str:
+    return getattr(settings, 'MARKET_DATA_COLUMNAR_ROOT', os.path.join(settings.BASE_DIR, 'var', 'ohlcv'))
+
+
+def is_columnar_store_enabled() -> bool:
+    return getattr(settings, 'MARKET_DATA_COLUMNAR_ENABLED', True)
+
+
+def to_epoch_ms(value) -> int:
+    """
+    Converts an aware datetime (or epoch ms int) to epoch milliseconds.
+    """
+    if isinstance(value, datetime):
+        return int(round(value.timestamp() * 1000))
+    return int(value)
+
+
+def from_epoch_ms(value) -> datetime:
+    """
+    Converts epoch milliseconds (or an aware datetime) to an aware UTC datetime.
+    """
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromtimestamp(int(value) / 1000.0, tz=dt_timezone.utc)
+
+
+def partition_for(timestamp_ms: int) -> str:
+    """
+    Returns the monthly partition key (YYYYMM, UTC) for an epoch-ms timestamp.
+    """
+    moment = datetime.fromtimestamp(timestamp_ms / 1000.0, tz=dt_timezone.utc)
+    return f"{moment.year:04d}{moment.month:02d}"
+
+
+def _partition_bounds(partition: str) -> Tuple[int, int]:
+    year, month = int(partition[:4]), int(partition[4:])
+    start = datetime(year, month, 1, tzinfo=dt_timezone.utc)
+    end = datetime(year + (month // 12), (month % 12) + 1, 1, tzinfo=dt_timezone.utc)
+    return to_epoch_ms(start), to_epoch_ms(end)
+
+
+class OHLCVArrays:
+    """
+    Column arrays for a range of candles, named after the MarketDataSnapshot fields.
+    Arrays are read-only NumPy views (memmap-backed where possible).
+    """
+    __slots__ = COLUMNS
+
+    def __init__(self, **columns):
+        for name in COLUMNS:
+            setattr(self, name, columns[name])
+
+    def __len__(self):
+        return len(self.timestamp)
+
+    @classmethod
+    def empty(cls) -> 'OHLCVArrays':
+        return cls(**{name: np.empty(0, dtype=COLUMN_DTYPES[name]) for name in COLUMNS})
+
+    @classmethod
+    def from_records(cls, records: np.ndarray) -> 'OHLCVArrays':
+        return cls(**{name: records[name] for name in COLUMNS})
+
+    @classmethod
+    def concatenate(cls, parts: List['OHLCVArrays']) -> 'OHLCVArrays':
+        parts = [part for part in parts if len(part)]
+        if not parts:
+            return cls.empty()
+        if len(parts) == 1:
+            return parts[0]
+        return cls(**{name: np.concatenate([getattr(part, name) for part in parts]) for name in COLUMNS})
+
+    def to_records(self) -> np.ndarray:
+        records = np.empty(len(self), dtype=ROW_DTYPE)
+        for name in COLUMNS:
+            records[name] = getattr(self, name)
+        return records
+
+    def slice_range(self, start_ms: Optional[int], end_ms: Optional[int]) -> 'OHLCVArrays':
+        """
+        Returns views for start_ms <= timestamp <= end_ms (timestamps must be sorted).
+        """
+        lo = 0 if start_ms is None else int(np.searchsorted(self.timestamp, start_ms, side='left'))
+        hi = len(self) if end_ms is None else int(np.searchsorted(self.timestamp, end_ms, side='right'))
+        return OHLCVArrays(**{name: getattr(self, name)[lo:hi] for name in COLUMNS})
+
+
+def snapshots_to_records(snapshots: Iterable) -> np.ndarray:
+    """
+    Converts MarketDataSnapshot instances (or objects with the same fields) to ROW_DTYPE rows.
+    """
+    return np.array(
+        [(to_epoch_ms(snapshot.timestamp), float(snapshot.open_price), float(snapshot.high_price),
+          float(snapshot.low_price), float(snapshot.close_price), float(snapshot.volume)) for snapshot in snapshots],
+        dtype=ROW_DTYPE,
+    )
+
+
+def merge_records(*record_blocks: np.ndarray) -> np.ndarray:
+    """
+    Merges row blocks into one array sorted by timestamp. For duplicate timestamps
+    the last written row wins (corrections overwrite earlier values).
+    """
+    blocks = [block for block in record_blocks if len(block)]
+    if not blocks:
+        return np.empty(0, dtype=ROW_DTYPE)
+    combined = np.concatenate(blocks)
+    # مرتب‌سازی پایدار تا ترتیب نوشتن برای timestampهای تکراری حفظ شود
+    order = np.argsort(combined['timestamp'], kind='stable')
+    combined = combined[order]
+    # نگه داشتن آخرین رکورد هر timestamp
+    keep = np.ones(len(combined), dtype=bool)
+    keep[:-1] = combined['timestamp'][1:] != combined['timestamp'][:-1]
+    return combined[keep]
+
+
+class ColumnarOHLCVStore:
+    """
+    File-based columnar store for closed OHLCV candles, one file per
+    (config, timeframe, monthly partition), read through np.memmap.
+    """
+
+    def __init__(self, root: Optional[str] = None):
+        self._root = root
+        # قدیمی‌ترین timestamp که هر (config, timeframe) هنوز در ژورنال ننوشته است (کندل باز)
+        self._pending_from = {}
+        self._closed_lock = threading.Lock()
+
+    @property
+    def root(self) -> str:
+        return self._root or get_columnar_root()
+
+    # --- مسیرها ---
+    def _partition_dir(self, config_id, timeframe: str) -> str:
+        return os.path.join(self.root, str(config_id), timeframe)
+
+    def _partition_path(self, config_id, timeframe: str, partition: str, suffix: str) -> str:
+        return os.path.join(self._partition_dir(config_id, timeframe), f"{partition}{suffix}")
+
+    def list_partitions(self, config_id, timeframe: str) -> List[str]:
+        directory = self._partition_dir(config_id, timeframe)
+        if not os.path.isdir(directory):
+            return []
+        partitions = {
+            name.split('.', 1)[0]
+            for name in os.listdir(directory)
+            if name.endswith(COLUMNAR_SUFFIX) or name.endswith(JOURNAL_SUFFIX)
+        }
+        return sorted(partitions)
+
+    @contextmanager
+    def _locked(self, config_id, timeframe: str, partition: str):
+        """
+        Exclusive advisory lock per partition (appenders vs. compaction).
+        """
+        directory = self._partition_dir(config_id, timeframe)
+        os.makedirs(directory, exist_ok=True)
+        lock_path = self._partition_path(config_id, timeframe, partition, '.lock')
+        with open(lock_path, 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    # --- نوشتن ---
+    def append(self, config_id, timeframe: str, records: np.ndarray) -> int:
+        """
+        Appends candle rows (ROW_DTYPE) to the journals of their partitions.
+        Returns the number of rows written.
+        """
+        if not len(records):
+            return 0
+        records = np.asarray(records, dtype=ROW_DTYPE)
+        months = records['timestamp'].astype('datetime64[ms]').astype('datetime64[M]')
+        for month in np.unique(months):
+            block = records[months == month]
+            partition = str(month).replace('-', '')
+            with self._locked(config_id, timeframe, partition):
+                with open(self._partition_path(config_id, timeframe, partition, JOURNAL_SUFFIX), 'ab') as journal:
+                    journal.write(block.tobytes())
+        self._update_bounds(config_id, timeframe, int(records['timestamp'].min()), int(records['timestamp'].max()))
+        return len(records)
+
+    def append_candle(self, config_id, timeframe: str, timestamp, open_price, high_price, low_price, close_price, volume) -> int:
+        """
+        Appends a single candle. Prices may be Decimal, float or str.
+        """
+        record = np.array(
+            [(to_epoch_ms(timestamp), float(open_price), float(high_price), float(low_price), float(close_price), float(volume))],
+            dtype=ROW_DTYPE,
+        )
+        return self.append(config_id, timeframe, record)
+
+    def append_closed_snapshots(self, config, snapshots, now_ms: Optional[int] = None) -> int:
+        """
+        Append path used by snapshot ingestion (saved MarketDataSnapshot instances of one config).
+        Only closed candles are journaled: a candle is closed once a newer candle arrives or its
+        period has ended. Candles closed since the last append (earlier open candles) are read
+        back from MarketDataSnapshot, so intra-bar updates of the open candle never reach the journal.
+        Returns the number of rows written.
+        """
+        from .resampling import timeframe_to_ms # Import داخل تابع برای جلوگیری از حلقه
+
+        records = snapshots_to_records(snapshots)
+        if not len(records):
+            return 0
+        timeframe = config.timeframe
+        timeframe_ms = timeframe_to_ms(timeframe)
+        now_ms = int(time.time() * 1000) if now_ms is None else now_ms
+        newest = int(records['timestamp'].max())
+        # مرز بالایی (انحصاری) کندل‌های بسته: کندل جدید تا پایان دوره‌اش باز است
+        boundary = newest + 1 if newest + timeframe_ms <= now_ms else newest
+
+        key = (str(config.id), timeframe)
+        with self._closed_lock:
+            pending_from = self._pending_from.get(key)
+        if pending_from is None:
+            last = self.last_timestamp(config.id, timeframe)
+            # مخزن خالی: پیگیری از قدیمی‌ترین کندل همین batch شروع می‌شود (قدیمی‌ترها از پایگاه داده خوانده می‌شوند)
+            pending_from = last + timeframe_ms if last is not None else int(records['timestamp'].min())
+
+        # کندل‌های قدیمی‌تر (backfill یا اصلاح) مستقیم از همین batch؛ کندل‌های تازه بسته‌شده از پایگاه داده
+        blocks = [records[records['timestamp'] < min(pending_from, boundary)]]
+        if boundary > pending_from:
+            blocks.append(_query_snapshot_records(config, pending_from, boundary - 1))
+            pending_from = boundary
+        written = self.append(config.id, timeframe, merge_records(*blocks))
+        with self._closed_lock:
+            self._pending_from[key] = max(pending_from, self._pending_from.get(key, pending_from))
+        return written
+
+    def compact_partition(self, config_id, timeframe: str, partition: str) -> int:
+        """
+        Folds the partition journal into its columnar file (sorted, de-duplicated)
+        and removes the journal. Returns the resulting row count.
+        """
+        with self._locked(config_id, timeframe, partition):
+            journal_path = self._partition_path(config_id, timeframe, partition, JOURNAL_SUFFIX)
+            columnar_path = self._partition_path(config_id, timeframe, partition, COLUMNAR_SUFFIX)
+            journal = self._read_journal(journal_path)
+            if not len(journal) and os.path.exists(columnar_path):
+                return self._read_header(columnar_path)
+
+            existing = self._open_columnar(columnar_path)
+            existing_records = existing.to_records() if existing is not None else np.empty(0, dtype=ROW_DTYPE)
+            merged = merge_records(existing_records, journal)
+            del existing # آزاد کردن memmap قبل از جایگزینی فایل
+
+            tmp_path = f"{columnar_path}.tmp"
+            self._write_columnar(tmp_path, merged)
+            os.replace(tmp_path, columnar_path)
+            if os.path.exists(journal_path):
+                os.remove(journal_path)
+            logger.debug(f"Compacted partition {partition} for config {config_id} ({timeframe}): {len(merged)} rows.")
+            return len(merged)
+
+    def compact(self, config_id, timeframe: str) -> int:
+        """
+        Compacts every partition of a (config, timeframe). Returns the number of partitions compacted.
+        """
+        compacted = 0
+        for partition in self.list_partitions(config_id, timeframe):
+            if os.path.exists(self._partition_path(config_id, timeframe, partition, JOURNAL_SUFFIX)):
+                self.compact_partition(config_id, timeframe, partition)
+                compacted += 1
+        return compacted
+
+    # --- خواندن ---
+    def iter_range(self, config_id, timeframe: str, start=None, end=None) -> Iterator[OHLCVArrays]:
+        """
+        Yields one OHLCVArrays per partition overlapping [start, end].
+        Memory stays bounded by one partition; compacted partitions are memmap views.
+        """
+        start_ms = to_epoch_ms(start) if start is not None else None
+        end_ms = to_epoch_ms(end) if end is not None else None
+        for partition in self.list_partitions(config_id, timeframe):
+            part_start, part_end = _partition_bounds(partition)
+            if (start_ms is not None and part_end <= start_ms) or (end_ms is not None and part_start > end_ms):
+                continue
+            arrays = self.read_partition(config_id, timeframe, partition)
+            arrays = arrays.slice_range(start_ms, end_ms)
+            if len(arrays):
+                yield arrays
+
+    def read_range(self, config_id, timeframe: str, start=None, end=None) -> OHLCVArrays:
+        """
+        Returns arrays for start <= timestamp <= end (inclusive, like in_date_range).
+        A range inside a single compacted partition is returned without copying.
+        """
+        return OHLCVArrays.concatenate(list(self.iter_range(config_id, timeframe, start, end)))
+
+    def read_partition(self, config_id, timeframe: str, partition: str) -> OHLCVArrays:
+        columnar = self._open_columnar(self._partition_path(config_id, timeframe, partition, COLUMNAR_SUFFIX))
+        journal = self._read_journal(self._partition_path(config_id, timeframe, partition, JOURNAL_SUFFIX))
+        if not len(journal):
+            return columnar if columnar is not None else OHLCVArrays.empty()
+        # ژورنال هنوز compact نشده است؛ ادغام در حافظه (فقط همین پارتیشن)
+        base = columnar.to_records() if columnar is not None else np.empty(0, dtype=ROW_DTYPE)
+        return OHLCVArrays.from_records(merge_records(base, journal))
+
+    def first_timestamp(self, config_id, timeframe: str) -> Optional[int]:
+        """
+        Returns the oldest stored timestamp (epoch ms) for a (config, timeframe), or None.
+        """
+        bounds = self.bounds(config_id, timeframe)
+        return bounds[0] if bounds is not None else None
+
+    def last_timestamp(self, config_id, timeframe: str) -> Optional[int]:
+        """
+        Returns the newest stored timestamp (epoch ms) for a (config, timeframe), or None.
+        """
+        bounds = self.bounds(config_id, timeframe)
+        return bounds[1] if bounds is not None else None
+
+    def bounds(self, config_id, timeframe: str) -> Optional[Tuple[int, int]]:
+        """
+        Returns (first, last) stored timestamps from the store metadata, or None.
+        The metadata is rebuilt from the partitions if it is missing (stores written before it existed).
+        """
+        bounds = self._read_bounds(self._partition_path(config_id, timeframe, BOUNDS_NAME, BOUNDS_SUFFIX))
+        if bounds is not None or not self.has_data(config_id, timeframe):
+            return bounds
+        return self._update_bounds(config_id, timeframe)
+
+    def _update_bounds(self, config_id, timeframe: str, first_ms: Optional[int] = None,
+                       last_ms: Optional[int] = None) -> Optional[Tuple[int, int]]:
+        """
+        Widens the stored (first, last) metadata to include [first_ms, last_ms].
+        """
+        path = self._partition_path(config_id, timeframe, BOUNDS_NAME, BOUNDS_SUFFIX)
+        with self._locked(config_id, timeframe, BOUNDS_NAME):
+            bounds = self._read_bounds(path)
+            if bounds is None:
+                # اولین بار: مرزها از خود پارتیشن‌ها (شامل رکوردهای همین append) ساخته می‌شوند
+                bounds = self._scan_bounds(config_id, timeframe)
+            elif first_ms is not None:
+                bounds = (min(bounds[0], first_ms), max(bounds[1], last_ms))
+            if bounds is None:
+                return None
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(BOUNDS_STRUCT.pack(*bounds))
+            os.replace(tmp_path, path)
+            return bounds
+
+    def _scan_bounds(self, config_id, timeframe: str) -> Optional[Tuple[int, int]]:
+        partitions = self.list_partitions(config_id, timeframe)
+        first_ms = last_ms = None
+        for partition in partitions:
+            arrays = self.read_partition(config_id, timeframe, partition)
+            if len(arrays):
+                first_ms = int(arrays.timestamp[0])
+                break
+        for partition in reversed(partitions):
+            arrays = self.read_partition(config_id, timeframe, partition)
+            if len(arrays):
+                last_ms = int(arrays.timestamp[-1])
+                break
+        return (first_ms, last_ms) if first_ms is not None else None
+
+    @staticmethod
+    def _read_bounds(path: str) -> Optional[Tuple[int, int]]:
+        try:
+            with open(path, 'rb') as f:
+                data = f.read(BOUNDS_STRUCT.size)
+        except FileNotFoundError:
+            return None
+        return BOUNDS_STRUCT.unpack(data) if len(data) == BOUNDS_STRUCT.size else None
+
+    def has_data(self, config_id, timeframe: str) -> bool:
+        return bool(self.list_partitions(config_id, timeframe))
+
+    # --- فایل ستونی ---
+    @staticmethod
+    def _read_header(path: str) -> int:
+        with open(path, 'rb') as f:
+            magic, version, column_count, row_count = HEADER_STRUCT.unpack(f.read(HEADER_SIZE))
+        if magic != MAGIC or version != FORMAT_VERSION or column_count != len(COLUMNS):
+            raise ValueError(f"Invalid columnar OHLCV file: {path}")
+        return row_count
+
+    @classmethod
+    def _open_columnar(cls, path: str) -> Optional[OHLCVArrays]:
+        if not os.path.exists(path):
+            return None
+        row_count = cls._read_header(path)
+        if row_count == 0:
+            return OHLCVArrays.empty()
+        columns = {}
+        offset = HEADER_SIZE
+        for name in COLUMNS:
+            dtype = COLUMN_DTYPES[name]
+            columns[name] = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(row_count,))
+            offset += row_count * dtype.itemsize
+        return OHLCVArrays(**columns)
+
+    @staticmethod
+    def _write_columnar(path: str, records: np.ndarray):
+        with open(path, 'wb') as f:
+            f.write(HEADER_STRUCT.pack(MAGIC, FORMAT_VERSION, len(COLUMNS), len(records)))
+            for name in COLUMNS:
+                f.write(np.ascontiguousarray(records[name], dtype=COLUMN_DTYPES[name]).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+    @staticmethod
+    def _read_journal(path: str) -> np.ndarray:
+        if not os.path.exists(path):
+            return np.empty(0, dtype=ROW_DTYPE)
+        size = os.path.getsize(path)
+        usable = size - (size % ROW_DTYPE.itemsize) # نادیده گرفتن رکورد ناقص (نوشتن نیمه‌کاره)
+        if usable <= 0:
+            return np.empty(0, dtype=ROW_DTYPE)
+        return np.fromfile(path, dtype=ROW_DTYPE, count=usable // ROW_DTYPE.itemsize)
+
+
+def load_ohlcv_arrays(config, start=None, end=None, store: Optional[ColumnarOHLCVStore] = None) -> OHLCVArrays:
+    """
+    MarketDataSnapshot-compatible read API: returns OHLCV arrays for a config in [start, end].
+    Reads from the columnar store for the range it covers; parts of [start, end] outside the
+    stored range, and holes inside it that the coverage index reports as stored in the database,
+    are read from the database with a values_list query and merged.
+    """
+    store = store or columnar_store
+    start_ms = to_epoch_ms(start) if start is not None else None
+    end_ms = to_epoch_ms(end) if end is not None else None
+    if not (is_columnar_store_enabled() and store.has_data(config.id, config.timeframe)):
+        return OHLCVArrays.from_records(_query_snapshot_records(config, start_ms, end_ms))
+
+    bounds = store.bounds(config.id, config.timeframe)
+    if bounds is None:
+        return OHLCVArrays.from_records(_query_snapshot_records(config, start_ms, end_ms))
+    first_ms, last_ms = bounds
+
+    stored = store.read_range(config.id, config.timeframe, start_ms, end_ms)
+    # بخش‌هایی از بازه که در انبار ستونی نیستند از دیتابیس خوانده می‌شوند
+    blocks = []
+    if start_ms is None or start_ms < first_ms:
+        blocks.append(_query_snapshot_records(config, start_ms, first_ms - 1))
+    window_start = first_ms if start_ms is None else max(start_ms, first_ms)
+    window_end = last_ms if end_ms is None else min(end_ms, last_ms)
+    holes = _stored_holes(config, stored, window_start, window_end)
+    if len(holes) > MAX_HOLE_QUERIES:
+        holes = [(holes[0][0], holes[-1][1])]
+    for hole_start, hole_end in holes:
+        blocks.append(_query_snapshot_records(config, hole_start, hole_end - 1))
+    if end_ms is None or end_ms > last_ms:
+        blocks.append(_query_snapshot_records(config, last_ms + 1, end_ms))
+    blocks = [block for block in blocks if len(block)]
+    if not blocks:
+        return stored
+    return OHLCVArrays.from_records(merge_records(stored.to_records(), *blocks))
+
+
+def _stored_holes(config, stored: OHLCVArrays, start_ms: int, end_ms: int) -> List[Tuple[int, int]]:
+    """
+    [start, end) ranges inside [start_ms, end_ms] that the coverage index marks as stored
+    in the database but that are missing from the columnar arrays.
+    """
+    from .coverage import IntervalSet, get_coverage_index, timestamps_to_runs # Import داخل تابع برای جلوگیری از حلقه
+
+    if start_ms > end_ms:
+        return []
+    index = get_coverage_index(config)
+    if index is None:
+        return []
+    present = IntervalSet(timestamps_to_runs(stored.timestamp, index.timeframe_ms))
+    window_end = end_ms + 1
+    holes = []
+    position = bisect_right(index.bars.ends, start_ms)
+    while position < len(index.bars) and index.bars.starts[position] < window_end:
+        bar_start = max(index.bars.starts[position], start_ms)
+        bar_end = min(index.bars.ends[position], window_end)
+        holes.extend(present.missing(bar_start, bar_end))
+        position += 1
+    return holes
+
+
+def _query_snapshot_records(config, start_ms: Optional[int], end_ms: Optional[int]) -> np.ndarray:
+    from .models import MarketDataSnapshot # Import داخل تابع برای جلوگیری از حلقه
+    queryset = MarketDataSnapshot.objects.filter(config=config)
+    if start_ms is not None:
+        queryset = queryset.filter(timestamp__gte=from_epoch_ms(start_ms))
+    if end_ms is not None:
+        queryset = queryset.filter(timestamp__lte=from_epoch_ms(end_ms))
+    rows = list(queryset.order_by('timestamp').values_list(
+        'timestamp', 'open_price', 'high_price', 'low_price', 'close_price', 'volume'
+    ))
+    records = np.empty(len(rows), dtype=ROW_DTYPE)
+    if rows:
+        timestamps, opens, highs, lows, closes, volumes = zip(*rows)
+        records['timestamp'] = [to_epoch_ms(ts) for ts in timestamps]
+        records['open_price'] = np.array(opens, dtype=float)
+        records['high_price'] = np.array(highs, dtype=float)
+        records['low_price'] = np.array(lows, dtype=float)
+        records['close_price'] = np.array(closes, dtype=float)
+        records['volume'] = np.array(volumes, dtype=float)
+    return records
+
+
+# نمونه سراسری (مسیر از settings.MARKET_DATA_COLUMNAR_ROOT)
+columnar_store = ColumnarOHLCVStore()
@@ -0,0 +1,487 @@
+# apps/market_data/streams.py
+
+"""
+Multiplexed WebSocket streams for real-time MarketDataConfigs.
+
+Configs are grouped by DataSource and packed into as few connections as the exchange
+allows (max streams per connection). Incoming frames are routed by stream name through
+a dict, so dispatch is O(1) regardless of how many configs share a connection. A dropped
+connection reconnects with jittered exponential backoff and resubscribes all of its
+streams; add()/remove()/sync() change subscriptions on live connections.
+"""
+
+import asyncio
+import json
+import logging
+import random
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+
+from apps.core.metrics import metrics
+from apps.market_data.normalizers import loads
+
+logger = logging.getLogger(__name__)
+
+METRIC_PREFIX = 'market_data.streams'
+
+# تنظیمات پیش‌فرض استریم؛ هر DataSource می‌تواند در config['streaming'] آن‌ها را بازنویسی کند
+DEFAULT_STREAMING = {
+    'max_streams_per_connection': None, # None -> سقف پروتکل صرافی
+    'backoff_base_seconds': 1.0,
+    'backoff_max_seconds': 60.0,
+}
+
+
+def get_streaming_settings(data_source) -> Dict[str, Any]:
+    merged = dict(DEFAULT_STREAMING)
+    source_config = getattr(data_source, 'config', None) or {}
+    overrides = source_config.get('streaming') or {}
+    if isinstance(overrides, dict):
+        merged.update(overrides)
+    return merged
+
+
+def get_source_code(data_source) -> str:
+    """
+    Exchange code of a DataSource (config['code'] or its name), e.g. 'BINANCE'.
+    """
+    source_config = getattr(data_source, 'config', None) or {}
+    return str(source_config.get('code') or data_source.name).upper()
+
+
+def backoff_delay(attempt: int, base: float, cap: float, rng: random.Random) -> float:
+    """
+    Full-jitter exponential backoff: uniform(0, min(cap, base * 2**attempt)).
+    """
+    return rng.uniform(0, min(cap, base * (2 ** min(attempt, 30))))
+
+
+# --- پروتکل استریم هر صرافی ---
+
+_STREAM_PROTOCOLS: Dict[str, type] = {}
+
+
+def register_stream_protocol(code: str):
+    def decorator(cls):
+        cls.code = code
+        _STREAM_PROTOCOLS[code] = cls
+        return cls
+    return decorator
+
+
+def get_stream_protocol(code: str):
+    protocol_class = _STREAM_PROTOCOLS.get(code.upper())
+    return protocol_class() if protocol_class else None
+
+
+class StreamProtocol:
+    """
+    Exchange-specific part of a multiplexed connection: stream names, (un)subscribe frames
+    and extracting the stream name of an incoming frame.
+    """
+    code = None
+    default_url = ''
+    max_streams_per_connection = 200
+    max_streams_per_message = 100
+
+    def stream_name(self, config) -> Optional[str]:
+        raise NotImplementedError
+
+    def subscribe_message(self, streams: List[str], request_id: int) -> str:
+        raise NotImplementedError
+
+    def unsubscribe_message(self, streams: List[str], request_id: int) -> str:
+        raise NotImplementedError
+
+    def route(self, frame: Dict) -> Optional[Tuple[str, Any]]:
+        """
+        Returns (stream name, payload), or None for control frames (subscription acks, pings).
+        """
+        raise NotImplementedError
+
+    def depth_snapshot_url(self, config) -> Optional[str]:
+        """
+        REST URL of a full order book snapshot, used to resync local books.
+        """
+        return None
+
+    def parse_depth_event(self, payload: Dict) -> Optional[Dict]:
+        """
+        Normalizes a depth payload to {'type': 'snapshot'|'diff', 'bids', 'asks', 'sequence',
+        'first_sequence', 'checksum', 'timestamp' (epoch ms)}.
+        """
+        return None
+
+    # --- کندل‌های تاریخی (REST) برای backfill ---
+    supports_rest_klines = False
+    klines_page_limit = 500
+    klines_request_weight = 1
+
+    def klines_url(self, config, start_ms: int, end_ms: int, limit: int) -> Optional[str]:
+        """
+        REST URL of up to `limit` candles opening in [start_ms, end_ms].
+        """
+        return None
+
+    def parse_klines(self, payload) -> List[Dict]:
+        """
+        Normalizes a klines response to [{'timestamp' (epoch ms, open time), 'open', 'high',
+        'low', 'close', 'volume', 'quote_volume', 'number_of_trades', ...}], oldest first.
+        """
+        return []
+
+
+@register_stream_protocol('BINANCE')
+class BinanceStreamProtocol(StreamProtocol):
+    """
+    Binance combined streams: frames arrive as {"stream": name, "data": payload}.
+    """
+    default_url = 'wss://stream.binance.com:9443/stream'
+    max_streams_per_connection = 1024
+    max_streams_per_message = 200
+
+    def stream_name(self, config) -> Optional[str]:
+        symbol = config.instrument.symbol.replace('/', '').lower()
+        if config.data_type == 'OHLCV':
+            return f"{symbol}@kline_{config.timeframe}"
+        if config.data_type in ('TICK', 'TRADES'):
+            return f"{symbol}@trade"
+        if config.data_type == 'ORDER_BOOK':
+            if config.depth_levels in (5, 10, 20):
+                return f"{symbol}@depth{config.depth_levels}@100ms"
+            return f"{symbol}@depth@100ms"
+        return None
+
+    def subscribe_message(self, streams: List[str], request_id: int) -> str:
+        return json.dumps({'method': 'SUBSCRIBE', 'params': streams, 'id': request_id})
+
+    def unsubscribe_message(self, streams: List[str], request_id: int) -> str:
+        return json.dumps({'method': 'UNSUBSCRIBE', 'params': streams, 'id': request_id})
+
+    def route(self, frame: Dict) -> Optional[Tuple[str, Any]]:
+        stream = frame.get('stream')
+        if stream is None:
+            return None
+        return stream, frame.get('data')
+
+    def depth_snapshot_url(self, config) -> Optional[str]:
+        base_url = (config.data_source.base_url or 'https://api.binance.com').rstrip('/')
+        symbol = config.instrument.symbol.replace('/', '').upper()
+        return f"{base_url}/api/v3/depth?symbol={symbol}&limit=1000"
+
+    supports_rest_klines = True
+    klines_page_limit = 1000
+    klines_request_weight = 2
+
+    def klines_url(self, config, start_ms: int, end_ms: int, limit: int) -> Optional[str]:
+        base_url = (config.data_source.base_url or 'https://api.binance.com').rstrip('/')
+        symbol = config.instrument.symbol.replace('/', '').upper()
+        return (
+            f"{base_url}/api/v3/klines?symbol={symbol}&interval={config.timeframe}"
+            f"&startTime={int(start_ms)}&endTime={int(end_ms)}&limit={int(limit)}"
+        )
+
+    def parse_klines(self, payload) -> List[Dict]:
+        # [open time, open, high, low, close, volume, close time, quote volume, trades, taker base, taker quote, -]
+        return [
+            {
+                'timestamp': int(row[0]),
+                'open': row[1],
+                'high': row[2],
+                'low': row[3],
+                'close': row[4],
+                'volume': row[5],
+                'quote_volume': row[7],
+                'number_of_trades': int(row[8]),
+                'taker_buy_base_asset_volume': row[9],
+                'taker_buy_quote_asset_volume': row[10],
+            }
+            for row in payload or []
+        ]
+
+    def parse_depth_event(self, payload: Dict) -> Optional[Dict]:
+        if payload.get('e') == 'depthUpdate':
+            return {
+                'type': 'diff',
+                'bids': payload.get('b', []),
+                'asks': payload.get('a', []),
+                'first_sequence': payload.get('U'),
+                'sequence': payload.get('u'),
+                'timestamp': payload.get('E'),
+            }
+        if 'lastUpdateId' in payload:
+            # snapshot REST یا استریم depth{N} (partial book)
+            return {
+                'type': 'snapshot',
+                'bids': payload.get('bids', []),
+                'asks': payload.get('asks', []),
+                'sequence': payload.get('lastUpdateId'),
+                'timestamp': payload.get('E') or payload.get('T'),
+            }
+        return None
+
+
+# --- اتصال چندگانه ---
+
+class StreamConnection:
+    """
+    One WebSocket carrying many streams of one DataSource.
+    """
+
+    def __init__(self, manager: 'MarketDataStreamManager', source_key: str, url: str, protocol: StreamProtocol,
+                 capacity: int, backoff_base: float, backoff_max: float):
+        self.manager = manager
+        self.source_key = source_key
+        self.url = url
+        self.protocol = protocol
+        self.capacity = capacity
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.streams: set = set()
+        self.websocket = None
+        self.reconnects = 0
+        self._closed = False
+        self._request_id = 0
+        self._send_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def free_slots(self) -> int:
+        return self.capacity - len(self.streams)
+
+    def start(self):
+        self._task = asyncio.create_task(self.run())
+
+    async def _send_batches(self, streams: List[str], subscribe: bool):
+        if self.websocket is None or not streams:
+            return
+        build = self.protocol.subscribe_message if subscribe else self.protocol.unsubscribe_message
+        step = self.protocol.max_streams_per_message
+        async with self._send_lock:
+            for start in range(0, len(streams), step):
+                self._request_id += 1
+                await self.websocket.send(build(streams[start:start + step], self._request_id))
+
+    async def subscribe(self, streams: List[str]):
+        new = [stream for stream in streams if stream not in self.streams]
+        self.streams.update(new)
+        await self._send_batches(new, subscribe=True)
+
+    async def unsubscribe(self, streams: List[str]):
+        removed = [stream for stream in streams if stream in self.streams]
+        self.streams.difference_update(removed)
+        await self._send_batches(removed, subscribe=False)
+
+    async def run(self):
+        attempt = 0
+        while not self._closed:
+            try:
+                self.websocket = await self.manager.connect(self.url)
+                # پس از هر اتصال (مجدد) همه استریم‌ها دوباره subscribe می‌شوند
+                await self._send_batches(sorted(self.streams), subscribe=True)
+                logger.info(f"Stream connection to {self.url} open with {len(self.streams)} streams.")
+                async for raw in self.websocket:
+                    attempt = 0
+                    await self.manager.dispatch(self, raw)
+                if self._closed:
+                    break
+                raise ConnectionError("WebSocket closed by server")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.websocket = None
+                if self._closed:
+                    break
+                delay = backoff_delay(attempt, self.backoff_base, self.backoff_max, self.manager.rng)
+                attempt += 1
+                self.reconnects += 1
+                metrics.incr(f'{METRIC_PREFIX}.reconnects')
+                logger.warning(f"Stream connection to {self.url} failed ({e}); reconnecting in {delay:.2f}s.")
+                await asyncio.sleep(delay)
+
+    async def close(self):
+        self._closed = True
+        websocket, self.websocket = self.websocket, None
+        if websocket is not None:
+            try:
+                await websocket.close()
+            except Exception as e:
+                logger.debug(f"Error closing stream connection {self.url}: {e}")
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+
+
+class MarketDataStreamManager:
+    """
+    Packs the streams of real-time MarketDataConfigs into shared connections per DataSource
+    and routes every frame to handler(payload, config).
+    """
+
+    def __init__(self, handler: Callable[[Any, Any], Awaitable[None]], connect=None, rng: Optional[random.Random] = None):
+        self.handler = handler
+        self._connect = connect
+        self.rng = rng or random.Random()
+        self._connections: Dict[str, List[StreamConnection]] = {} # source_key -> connections
+        self._routes: Dict[str, Dict[str, Dict[Any, Any]]] = {} # source_key -> {stream: {config_id: config}}
+        self._config_streams: Dict[Any, Tuple[str, str]] = {} # config_id -> (source_key, stream)
+        self._lock = asyncio.Lock()
+
+    async def connect(self, url: str):
+        if self._connect is None:
+            import websockets # Import داخل تابع؛ websockets فقط برای اتصال واقعی لازم است
+            self._connect = websockets.connect
+        return await self._connect(url)
+
+    # --- مدیریت اشتراک‌ها ---
+    async def add(self, config) -> bool:
+        async with self._lock:
+            return await self._add(config)
+
+    async def remove(self, config_id) -> bool:
+        async with self._lock:
+            return await self._remove(config_id)
+
+    async def sync(self, configs: Iterable) -> Dict[str, int]:
+        """
+        Makes the subscriptions match configs: new ones are added, missing ones removed,
+        changed ones (different stream) moved. Untouched streams are not resent.
+        """
+        async with self._lock:
+            wanted = {config.id: config for config in configs}
+            removed = added = 0
+            for config_id in list(self._config_streams):
+                config = wanted.get(config_id)
+                if config is None or self._config_streams[config_id] != self._stream_key(config):
+                    removed += await self._remove(config_id)
+            for config_id, config in wanted.items():
+                if config_id in self._config_streams:
+                    # شیء کانفیگ تازه‌سازی می‌شود تا هندلر همیشه آخرین نسخه را ببیند
+                    source_key, stream = self._config_streams[config_id]
+                    self._routes[source_key][stream][config_id] = config
+                else:
+                    added += await self._add(config)
+            return {'added': added, 'removed': removed}
+
+    def _stream_key(self, config) -> Optional[Tuple[str, str]]:
+        protocol = get_stream_protocol(get_source_code(config.data_source))
+        if protocol is None:
+            return None
+        stream = protocol.stream_name(config)
+        return (str(config.data_source_id), stream) if stream else None
+
+    async def _add(self, config) -> bool:
+        protocol = get_stream_protocol(get_source_code(config.data_source))
+        if protocol is None:
+            logger.error(f"No stream protocol for source: {config.data_source.name}")
+            return False
+        stream = protocol.stream_name(config)
+        if stream is None:
+            logger.warning(f"Data type {config.data_type} is not streamable from {config.data_source.name}")
+            return False
+        source_key = str(config.data_source_id)
+        routes = self._routes.setdefault(source_key, {})
+        subscribers = routes.get(stream)
+        self._config_streams[config.id] = (source_key, stream)
+        if subscribers:
+            # استریم قبلاً روی یک اتصال باز است؛ فقط مسیر جدید اضافه می‌شود
+            subscribers[config.id] = config
+            return True
+        routes[stream] = {config.id: config}
+        connection = self._connection_with_room(source_key, config.data_source, protocol)
+        await connection.subscribe([stream])
+        metrics.gauge(f'{METRIC_PREFIX}.streams', sum(len(r) for r in self._routes.values()))
+        return True
+
+    async def _remove(self, config_id) -> bool:
+        entry = self._config_streams.pop(config_id, None)
+        if entry is None:
+            return False
+        source_key, stream = entry
+        subscribers = self._routes.get(source_key, {}).get(stream)
+        if subscribers is None:
+            return True
+        subscribers.pop(config_id, None)
+        if subscribers:
+            return True
+        del self._routes[source_key][stream]
+        for connection in list(self._connections.get(source_key, [])):
+            if stream in connection.streams:
+                await connection.unsubscribe([stream])
+                if not connection.streams:
+                    self._connections[source_key].remove(connection)
+                    await connection.close()
+                break
+        metrics.gauge(f'{METRIC_PREFIX}.streams', sum(len(r) for r in self._routes.values()))
+        return True
+
+    def _connection_with_room(self, source_key: str, data_source, protocol: StreamProtocol) -> StreamConnection:
+        connections = self._connections.setdefault(source_key, [])
+        for connection in connections:
+            if connection.free_slots > 0:
+                return connection
+        streaming = get_streaming_settings(data_source)
+        connection = StreamConnection(
+            self, source_key,
+            url=data_source.ws_url or protocol.default_url,
+            protocol=protocol,
+            capacity=int(streaming['max_streams_per_connection'] or protocol.max_streams_per_connection),
+            backoff_base=float(streaming['backoff_base_seconds']),
+            backoff_max=float(streaming['backoff_max_seconds']),
+        )
+        connections.append(connection)
+        connection.start()
+        metrics.gauge(f'{METRIC_PREFIX}.connections', sum(len(c) for c in self._connections.values()))
+        return connection
+
+    # --- مسیریابی پیام‌ها ---
+    async def dispatch(self, connection: StreamConnection, raw) -> int:
+        """
+        Routes one raw frame to the handlers of its stream; returns the number of handlers called.
+        """
+        try:
+            frame = loads(raw) if isinstance(raw, (str, bytes, bytearray)) else raw
+            routed = connection.protocol.route(frame)
+        except (ValueError, AttributeError) as e:
+            metrics.incr(f'{METRIC_PREFIX}.invalid_frames')
+            logger.warning(f"Invalid frame on {connection.url}: {e}")
+            return 0
+        if routed is None:
+            return 0
+        stream, payload = routed
+        subscribers = self._routes.get(connection.source_key, {}).get(stream)
+        if not subscribers:
+            metrics.incr(f'{METRIC_PREFIX}.unrouted')
+            return 0
+        metrics.incr(f'{METRIC_PREFIX}.messages')
+        for config in list(subscribers.values()):
+            try:
+                await self.handler(payload, config)
+            except Exception as e:
+                logger.error(f"Stream handler failed for {stream}: {e}")
+        return len(subscribers)
+
+    async def close(self):
+        async with self._lock:
+            for connections in self._connections.values():
+                for connection in connections:
+                    await connection.close()
+            self._connections.clear()
+            self._routes.clear()
+            self._config_streams.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'connections': sum(len(c) for c in self._connections.values()),
+            'streams': sum(len(r) for r in self._routes.values()),
+            'configs': len(self._config_streams),
+            'reconnects': sum(conn.reconnects for c in self._connections.values() for conn in c),
+        }
+
+
+def get_stream_sync_interval() -> float:
+    return float(getattr(settings, 'MARKET_DATA_STREAM_SYNC_SECONDS', 10))
@@ -2,6 +2,8 @@
 
 from celery import shared_task
 import logging
+from datetime import datetime
+from django.db.models import F, Max, Min, Sum
 from django.utils import timezone
 from django.core.exceptions import ObjectDoesNotExist
 from .models import (
@@ -43,6 +45,11 @@ def fetch_and_store_historical_data_task(self, config_id: int, sync_log_id: int)
 
         logger.info(f"Starting historical sync task for config {config.id} (Symbol: {config.instrument.symbol}, TF: {config.timeframe}).")
 
+        if config.data_type == 'OHLCV':
+            # کندل‌ها از آخرین کندل ذخیره‌شده تا الان با موتور backfill (صفحه‌بندی، هم‌زمانی، قابل ادامه) دریافت می‌شوند
+            run_backfill(config, sync_log)
+            return
+
         # 2. شروع زمان‌بندی
         start_time = timezone.now()
 
@@ -76,25 +83,15 @@ def fetch_and_store_historical_data_task(self, config_id: int, sync_log_id: int)
             sync_log.save(update_fields=['status', 'error_message', 'end_time'])
             return
 
-        # 6. پردازش و ذخیره داده
+        # 6. پردازش و ذخیره داده (OHLCV بالاتر به run_backfill سپرده شده است)
         records_synced_count = 0
-        for raw_candle_or_tick in raw_data:
-            # چون داده ممکن است TICK یا OHLCV باشد، باید نوع کانفیگ را چک کنیم
-            if config.data_type == 'OHLCV':
-                # استفاده از سرویس برای پردازش
-                try:
-                    MarketDataService.process_received_snapshot_data(config, raw_candle_or_tick)
-                    records_synced_count += 1
-                except Exception as e:
-                    logger.warning(f"Failed to process snapshot data {raw_candle_or_tick} for config {config.id} in task: {str(e)}")
-                    # ممکن است بخواهید ادامه دهید و فقط خطاها را لاگ کنید
-                    continue
-            elif config.data_type == 'TICK':
+        for raw_tick in raw_data:
+            if config.data_type == 'TICK':
                  try:
-                     MarketDataService.process_received_tick_data(config, raw_candle_or_tick)
+                     MarketDataService.process_received_tick_data(config, raw_tick)
                      records_synced_count += 1
                  except Exception as e:
-                     logger.warning(f"Failed to process tick data {raw_candle_or_tick} for config {config.id} in task: {str(e)}")
+                     logger.warning(f"Failed to process tick data {raw_tick} for config {config.id} in task: {str(e)}")
                      continue
             # سایر انواع داده...
 
@@ -142,6 +139,124 @@ def fetch_and_store_historical_data_task(self, config_id: int, sync_log_id: int)
         raise # Celery retry
 
 
+def run_backfill(config, sync_log, start_ms: int = None, end_ms: int = None, fill_gaps: bool = False):
+    """
+    Runs the backfill engine for a config. Without an explicit start, the range starts at the
+    newest stored candle (or the default lookback); with fill_gaps only missing candles are fetched.
+    """
+    from .backfill import backfill_engine, get_backfill_settings # Import داخل تابع برای جلوگیری از حلقه
+    from .coverage import get_coverage_index
+    from .storage import to_epoch_ms
+
+    end_ms = end_ms or to_epoch_ms(timezone.now())
+    if start_ms is None:
+        # آخرین کندل از ایندکس پوشش خوانده می‌شود؛ در نبود ایندکس از جدول snapshot
+        index = get_coverage_index(config)
+        bounds = index.bars.bounds() if index is not None else None
+        newest = None if bounds else MarketDataSnapshot.objects.filter(config=config).aggregate(newest=Max('timestamp'))['newest']
+        if bounds:
+            start_ms = bounds[1] - index.timeframe_ms
+        elif newest is not None:
+            start_ms = to_epoch_ms(newest)
+        else:
+            lookback_days = get_backfill_settings(config.data_source)['default_lookback_days']
+            start_ms = to_epoch_ms(timezone.now() - timezone.timedelta(days=lookback_days))
+    ranges = backfill_engine.find_gaps(config, start_ms, end_ms) if fill_gaps else None
+
+    state = backfill_engine.run(config, sync_log, start_ms=start_ms, end_ms=end_ms, ranges=ranges)
+    if not state.get('failed'):
+        config.last_sync_at = timezone.now()
+        config.save(update_fields=['last_sync_at'])
+    return state
+
+
+@shared_task(bind=True, acks_late=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 3, 'countdown': 60})
+def backfill_historical_data_task(self, config_id, sync_log_id, start_ms: int = None, end_ms: int = None, fill_gaps: bool = False):
+    """
+    Celery task for backfilling a config's candles over [start_ms, end_ms).
+    Progress is checkpointed in the sync log, so retries and redeliveries resume instead of restarting.
+    """
+    try:
+        config = MarketDataConfig.objects.select_related('data_source', 'instrument').get(id=config_id)
+        sync_log = MarketDataSyncLog.objects.get(id=sync_log_id)
+    except ObjectDoesNotExist as e:
+        logger.error(f"Config (ID: {config_id}) or SyncLog (ID: {sync_log_id}) not found in backfill task: {e}")
+        return
+    try:
+        state = run_backfill(config, sync_log, start_ms=start_ms, end_ms=end_ms, fill_gaps=fill_gaps)
+        return {'candles': state.get('candles', 0), 'progress': state.get('progress')}
+    except Exception as e:
+        logger.error(f"Error in backfill_historical_data_task for config {config_id}: {str(e)}")
+        raise # Celery retry (ادامه از checkpoint)
+
+
+@shared_task(bind=True)
+def schedule_gap_backfills_task(self, days: int = None):
+    """
+    Celery task that looks up missing candles of historical OHLCV configs in the coverage index
+    and starts a gap-filling backfill for configs that have any.
+    """
+    from datetime import timedelta
+    from django.conf import settings
+    from .coverage import get_missing_ranges # Import داخل تابع برای جلوگیری از حلقه
+    from .resampling import timeframe_to_ms
+    from .storage import to_epoch_ms
+    from .streams import get_source_code, get_stream_protocol
+
+    days = days or getattr(settings, 'MARKET_DATA_GAP_SCAN_DAYS', 7)
+    now_ms = to_epoch_ms(timezone.now())
+    stale_after = timezone.now() - timedelta(seconds=getattr(settings, 'MARKET_DATA_GAP_BACKFILL_STALE_SECONDS', 3600))
+    configs = MarketDataConfig.objects.filter(
+        is_historical=True, data_type='OHLCV', data_source__is_active=True,
+    ).select_related('data_source')
+    scheduled = 0
+    klines_support = {}
+    for config in configs:
+        try:
+            # منابع بدون endpoint REST برای klines قابل backfill نیستند (هر بار با خطا تمام می‌شد)
+            source_code = get_source_code(config.data_source)
+            if source_code not in klines_support:
+                protocol = get_stream_protocol(source_code)
+                klines_support[source_code] = bool(protocol and protocol.supports_rest_klines)
+            if not klines_support[source_code]:
+                continue
+            timeframe_ms = timeframe_to_ms(config.timeframe)
+            # کندل جاری هنوز بسته نشده و جزو شکاف‌ها حساب نمی‌شود
+            end_ms = (now_ms // timeframe_ms) * timeframe_ms
+            gaps = get_missing_ranges(config, end_ms - days * 86_400_000, end_ms)
+            if not gaps:
+                continue
+            # backfill در حال اجرای همین کانفیگ دوباره زمان‌بندی نمی‌شود
+            in_progress = MarketDataSyncLog.objects.filter(
+                config=config, status='PARTIAL', details__triggered_by='backfill', end_time__gte=stale_after,
+            ).exists()
+            if in_progress:
+                continue
+            MarketDataService.trigger_backfill(config, gaps[0][0], gaps[-1][1], fill_gaps=True)
+            scheduled += 1
+        except Exception as e:
+            logger.error(f"Error scheduling gap backfill for config {config.id}: {str(e)}")
+    logger.info(f"Scheduled gap backfills for {scheduled} configs.")
+    return scheduled
+
+
+@shared_task(bind=True)
+def rebuild_coverage_task(self, config_id=None):
+    """
+    Celery task that rebuilds the coverage index of one config (or all OHLCV configs) from stored candles.
+    """
+    from .coverage import rebuild_coverage # Import داخل تابع برای جلوگیری از حلقه
+
+    configs = MarketDataConfig.objects.filter(data_type='OHLCV')
+    if config_id is not None:
+        configs = configs.filter(id=config_id)
+    for config in configs:
+        try:
+            rebuild_coverage(config)
+        except Exception as e:
+            logger.error(f"Error rebuilding coverage index for config {config.id}: {str(e)}")
+
+
 @shared_task(bind=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 2, 'countdown': 30})
 def process_tick_data_task(self, tick_id: int):
     """
@@ -172,16 +287,65 @@ def process_tick_data_task(self, tick_id: int):
         raise # Celery retry
 
 
+@shared_task(bind=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 2, 'countdown': 30})
+def process_tick_batch_task(self, config_id: int, start_timestamp: str, end_timestamp: str, tick_count: int):
+    """
+    Celery task for processing a batch of ticks flushed by the TickBatcher.
+    Replaces one process_tick_data_task per tick with one event per flush.
+    """
+    try:
+        start_time = datetime.fromisoformat(start_timestamp)
+        end_time = datetime.fromisoformat(end_timestamp)
+        ticks = MarketDataTick.objects.filter(
+            config_id=config_id,
+            timestamp__gte=start_time,
+            timestamp__lte=end_time,
+        )
+        aggregates = ticks.aggregate(
+            total_quantity=Sum('quantity'),
+            notional=Sum(F('price') * F('quantity')),
+            high=Max('price'),
+            low=Min('price'),
+        )
+
+        # مثال ساده: محاسبه VWAP بچ؛ سایر پردازش‌ها (ارسال به عامل‌ها، هشدارها) می‌توانند اینجا اضافه شوند
+        vwap = None
+        if aggregates['total_quantity']:
+            vwap = aggregates['notional'] / aggregates['total_quantity']
+
+        logger.info(
+            f"Processed tick batch for config {config_id}: {tick_count} ticks "
+            f"({start_timestamp} -> {end_timestamp}), VWAP: {vwap}, high: {aggregates['high']}, low: {aggregates['low']}."
+        )
+
+    except Exception as e:
+        logger.error(f"Error in process_tick_batch_task for config {config_id}: {str(e)}")
+        raise # Celery retry
+
+
 @shared_task(bind=True)
 def cleanup_old_snapshots_task(self, days_to_keep: int = 30):
     """
     Celery task for periodically cleaning up old MarketDataSnapshot records.
-    This should be scheduled using Celery Beat.
+    Drops whole expired partitions; falls back to a row delete on unpartitioned tables.
     """
+    from .coverage import trim_coverage_before # Import داخل تابع برای جلوگیری از حلقه
+    from .partitioning import dropped_until, partition_manager
     try:
-        cutoff_date = timezone.now() - timezone.timedelta(days=days_to_keep)
-        deleted_count, _ = MarketDataSnapshot.objects.filter(timestamp__lt=cutoff_date).delete()
-        logger.info(f"Cleanup task removed {deleted_count} snapshots older than {days_to_keep} days.")
+        dropped = partition_manager.enforce_retention('MarketDataSnapshot', days_to_keep)
+        if dropped is not None:
+            logger.info(f"Cleanup task dropped {len(dropped)} snapshot partitions older than {days_to_keep} days.")
+            # فقط تا مرز بالای آخرین پارتیشن حذف‌شده؛ ردیف‌های بعد از آن تا cutoff هنوز موجودند
+            trim_until = dropped_until(dropped)
+        else:
+            cutoff_date = timezone.now() - timezone.timedelta(days=days_to_keep)
+            deleted_count, _ = MarketDataSnapshot.objects.filter(timestamp__lt=cutoff_date).delete()
+            logger.info(f"Cleanup task removed {deleted_count} snapshots older than {days_to_keep} days.")
+            trim_until = cutoff_date if deleted_count else None
+        # ایندکس پوشش نباید کندل‌های حذف‌شده را موجود گزارش کند
+        if trim_until is not None:
+            trimmed = trim_coverage_before(trim_until)
+            logger.info(f"Trimmed coverage index of {trimmed} configs to {trim_until}.")
     except Exception as e:
         logger.error(f"Error in cleanup_old_snapshots_task: {str(e)}")
         raise # Celery retry
@@ -191,9 +355,14 @@ def cleanup_old_snapshots_task(self, days_to_keep: int = 30):
 def cleanup_old_orderbooks_task(self, days_to_keep: int = 7):
     """
     Celery task for periodically cleaning up old MarketDataOrderBook records.
-    This should be scheduled using Celery Beat.
+    Drops whole expired partitions; falls back to a row delete on unpartitioned tables.
     """
+    from .partitioning import partition_manager # Import داخل تابع برای جلوگیری از حلقه
     try:
+        dropped = partition_manager.enforce_retention('MarketDataOrderBook', days_to_keep)
+        if dropped is not None:
+            logger.info(f"Cleanup task dropped {len(dropped)} order book partitions older than {days_to_keep} days.")
+            return
         cutoff_date = timezone.now() - timezone.timedelta(days=days_to_keep)
         deleted_count, _ = MarketDataOrderBook.objects.filter(timestamp__lt=cutoff_date).delete()
         logger.info(f"Cleanup task removed {deleted_count} order books older than {days_to_keep} days.")
@@ -201,6 +370,93 @@ def cleanup_old_orderbooks_task(self, days_to_keep: int = 7):
         logger.error(f"Error in cleanup_old_orderbooks_task: {str(e)}")
         raise # Celery retry
 
+
+@shared_task(bind=True)
+def maintain_market_data_partitions_task(self):
+    """
+    Periodic task: creates upcoming partitions and drops expired ones for snapshots, ticks and order books.
+    The coverage index is trimmed when snapshot partitions were dropped.
+    """
+    from .coverage import trim_coverage_before # Import داخل تابع برای جلوگیری از حلقه
+    from .partitioning import partition_manager
+    try:
+        report = partition_manager.maintain()
+        for model_name, changes in report.items():
+            if changes['created'] or changes['dropped']:
+                logger.info(
+                    f"Partitions of {model_name}: ensured {len(changes['created'])}, dropped {len(changes['dropped'])}."
+                )
+        # فقط کندل‌ها (MarketDataSnapshot) در coverage ثبت می‌شوند؛ تیک و دفتر سفارش ایندکس پوشش ندارند
+        trim_until = report.get('MarketDataSnapshot', {}).get('dropped_until')
+        if trim_until is not None:
+            trimmed = trim_coverage_before(trim_until)
+            logger.info(f"Trimmed coverage index of {trimmed} configs to {trim_until}.")
+        return report
+    except Exception as e:
+        logger.error(f"Error in maintain_market_data_partitions_task: {str(e)}")
+        raise
+
+@shared_task(bind=True)
+def compact_columnar_ohlcv_task(self, config_id: int = None):
+    """
+    Celery task for folding columnar OHLCV journals into their partition files.
+    Compacts all OHLCV configs unless config_id is given. Scheduled by Celery Beat.
+    """
+    from .storage import columnar_store # Import داخل تابع برای جلوگیری از حلقه
+    try:
+        configs = MarketDataConfig.objects.filter(data_type='OHLCV')
+        if config_id is not None:
+            configs = configs.filter(id=config_id)
+
+        compacted_partitions = 0
+        for config in configs.only('id', 'timeframe'):
+            compacted_partitions += columnar_store.compact(config.id, config.timeframe)
+        logger.info(f"Columnar compaction task compacted {compacted_partitions} partitions.")
+        return compacted_partitions
+    except Exception as e:
+        logger.error(f"Error in compact_columnar_ohlcv_task: {str(e)}")
+        raise # Celery retry
+
+@shared_task(bind=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 2, 'countdown': 30})
+def materialize_timeframe_task(self, config_id: int, target_timeframe: str, alignment: str = 'UTC'):
+    """
+    Celery task for materializing a higher timeframe from a config's source candles
+    into the columnar store. Incremental: only bars from the last materialized bucket onward are resampled.
+    """
+    from .resampling import get_bucket_offset_ms, resample_ohlcv # Import داخل تابع برای جلوگیری از حلقه
+    from .storage import columnar_store, load_ohlcv_arrays
+    try:
+        config = MarketDataConfig.objects.select_related('data_source').get(id=config_id)
+        offset_ms = get_bucket_offset_ms(target_timeframe, alignment, config.data_source)
+
+        # باکت آخر ممکن است ناقص ذخیره شده باشد؛ از ابتدای همان باکت دوباره محاسبه می‌شود (last-write-wins)
+        last_bucket = columnar_store.last_timestamp(config.id, target_timeframe)
+        source = load_ohlcv_arrays(config, start=last_bucket)
+        buckets = resample_ohlcv(source, target_timeframe, offset_ms)
+        written = columnar_store.append(config.id, target_timeframe, buckets.to_records())
+        columnar_store.compact(config.id, target_timeframe)
+
+        logger.info(f"Materialized {written} {target_timeframe} buckets for config {config_id} from {len(source)} source bars.")
+        return written
+    except MarketDataConfig.DoesNotExist:
+        logger.error(f"MarketDataConfig with id {config_id} not found in materialize_timeframe_task.")
+    except Exception as e:
+        logger.error(f"Error in materialize_timeframe_task for config {config_id} ({target_timeframe}): {str(e)}")
+        raise # Celery retry
+
+@shared_task(bind=True)
+def checkpoint_market_state_task(self):
+    """
+    Periodic task: persists the hot market state of recently updated configs to MarketDataCache.
+    """
+    try:
+        checkpointed = MarketDataService.checkpoint_market_state()
+        logger.debug(f"Market state checkpoint wrote {checkpointed} cache entries.")
+        return checkpointed
+    except Exception as e:
+        logger.error(f"Error in checkpoint_market_state_task: {str(e)}")
+        raise
+
 # سایر تاسک‌های مرتبط می‌توانند اضافه شوند
 # مثلاً:
 # - تاسک برای همگام‌سازی داده‌های نمادها از صرافی‌ها
@@ -4,6 +4,8 @@ from rest_framework import viewsets, permissions, status, generics
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
 from django.utils import timezone
 from django.db.models import Q
 from .models import (
@@ -25,8 +27,10 @@ from .serializers import (
     MarketDataCacheSerializer,
 )
 from .services import MarketDataService # فرض بر این است که این سرویس وجود دارد
+from .hot_cache import hot_market_cache
+from .storage import from_epoch_ms
 from .permissions import IsOwnerOfMarketDataConfig, HasReadAccessToDataSource # فرض بر این است که این اجازه‌نامه‌ها وجود دارند
-from .exceptions import DataSyncError, DataFetchError # فرض بر این است که این استثناها وجود دارند
+from .exceptions import DataSyncError, DataFetchError, DataProcessingError # فرض بر این است که این استثناها وجود دارند
 from apps.core.views import SecureModelViewSet # فرض بر این است که این نما وجود دارد
 from apps.agents.models import Agent # فرض بر این است که مدل Agent وجود دارد (برای اتصال به عامل داده)
 
@@ -76,6 +80,27 @@ class MarketDataConfigViewSet(SecureModelViewSet):
             # لاگ کنید
             return Response({"error": "An error occurred during sync trigger."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    @action(detail=True, methods=['get'])
+    def coverage(self, request, pk=None):
+        """
+        Returns the data coverage of this config over [start_time, end_time) (ISO 8601 or epoch ms).
+        Defaults to the last MARKET_DATA_GAP_SCAN_DAYS days.
+        """
+        config = self.get_object()
+        try:
+            end = _parse_time_param(request.query_params.get('end_time')) or timezone.now()
+            start = _parse_time_param(request.query_params.get('start_time')) or end - timedelta(days=getattr(settings, 'MARKET_DATA_GAP_SCAN_DAYS', 7))
+            limit = min(int(request.query_params.get('limit', 100)), 1000)
+        except ValueError:
+            return Response({"error": "Invalid start_time, end_time or limit."}, status=status.HTTP_400_BAD_REQUEST)
+        if start >= end:
+            return Response({"error": "start_time must be before end_time."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            report = MarketDataService.get_data_coverage(config, start, end, limit=limit)
+            return Response({"config_id": str(config.id), "timeframe": config.timeframe, **report})
+        except DataProcessingError as e:
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
     @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated, IsOwnerOfMarketDataConfig])
     def subscribe_agent(self, request, pk=None):
         """
@@ -125,6 +150,16 @@ class MarketDataConfigViewSet(SecureModelViewSet):
             return Response({"error": "An error occurred unsubscribing the agent."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+def _parse_time_param(value):
+    # زمان به صورت ISO 8601 یا epoch میلی‌ثانیه پذیرفته می‌شود
+    if not value:
+        return None
+    if value.isdigit():
+        return from_epoch_ms(int(value))
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed, dt_timezone.utc)
+
+
 # --- نماهای MarketDataSnapshot ---
 class MarketDataSnapshotViewSet(viewsets.ReadOnlyModelViewSet): # معمولاً فقط خواندنی
     """
@@ -177,6 +212,11 @@ class MarketDataSnapshotViewSet(viewsets.ReadOnlyModelViewSet): # معمولاً
         if not instrument_symbol or not timeframe:
             return Response({"error": "instrument and timeframe are required."}, status=status.HTTP_400_BAD_REQUEST)
 
+        # کش داغ بازار (کندل‌ها با همین serializer در کش نوشته می‌شوند)؛ در صورت نبود داده به پایگاه داده مراجعه می‌شود
+        cached = hot_market_cache.get_latest_candle(instrument_symbol, timeframe)
+        if cached is not None:
+            return Response(cached)
+
         try:
             latest_snapshot = MarketDataSnapshot.objects.filter(
                 config__instrument__symbol__iexact=instrument_symbol,
@@ -227,6 +227,33 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
+CELERY_BEAT_SCHEDULE = {
+    # snapshot دوره‌ای وضعیت محدودیت درخواست‌ها (RateLimitState فقط برای مشاهده‌پذیری)
+    'snapshot-rate-limit-state': {
+        'task': 'apps.connectors.tasks.snapshot_rate_limit_state',
+        'schedule': 30.0,
+    },
+    # checkpoint دوره‌ای کش داغ بازار در جدول MarketDataCache
+    'checkpoint-market-state-cache': {
+        'task': 'apps.market_data.tasks.checkpoint_market_state_task',
+        'schedule': 15.0,
+    },
+    # ساخت پارتیشن‌های آینده و حذف پارتیشن‌های منقضی جداول سری زمانی
+    'maintain-market-data-partitions': {
+        'task': 'apps.market_data.tasks.maintain_market_data_partitions_task',
+        'schedule': 3600.0,
+    },
+    # زمان‌بندی backfill شکاف‌های کندل بر اساس ایندکس پوشش
+    'schedule-market-data-gap-backfills': {
+        'task': 'apps.market_data.tasks.schedule_gap_backfills_task',
+        'schedule': 900.0,
+    },
+    # ادغام ژورنال‌های ذخیره‌ساز ستونی در فایل‌های پارتیشن (محدود نگه داشتن ادغام در حافظه هنگام خواندن)
+    'compact-columnar-ohlcv': {
+        'task': 'apps.market_data.tasks.compact_columnar_ohlcv_task',
+        'schedule': 600.0,
+    },
+}
 
 
 # Cache: برای django-filter حتماً Redis cache را در settings.py تنظیم کنید:
@@ -249,6 +276,82 @@ CACHES = {
 }
 
 
+# Market Data: ذخیره‌ساز ستونی کندل‌ها (np.memmap)
+MARKET_DATA_COLUMNAR_ENABLED = env_settings.bool('MARKET_DATA_COLUMNAR_ENABLED', default=True)
+MARKET_DATA_COLUMNAR_ROOT = env_settings('MARKET_DATA_COLUMNAR_ROOT', default=os.path.join(BASE_DIR, 'var', 'ohlcv'))
+
+# Market Data: rollup کندل‌های 1m به تایم‌فریم‌های بالاتر ('memory' یا 'redis')
+MARKET_DATA_ROLLUP_ENABLED = env_settings.bool('MARKET_DATA_ROLLUP_ENABLED', default=True)
+MARKET_DATA_ROLLUP_BACKEND = env_settings('MARKET_DATA_ROLLUP_BACKEND', default='memory')
+MARKET_DATA_ROLLUP_TIMEFRAMES = ['5m', '15m', '1h', '4h', '1d']
+MARKET_DATA_ROLLUP_MAX_LATENESS_MINUTES = 24 * 60
+# مهلت قفل هر کانفیگ در بک‌اند redis (load/modify/save وضعیت باکت‌های باز)
+MARKET_DATA_ROLLUP_LOCK_TIMEOUT_SECONDS = 30
+
+# Market Data: استریم‌های WebSocket چندگانه (فاصله همگام‌سازی اشتراک‌ها با کانفیگ‌های فعال)
+MARKET_DATA_STREAM_SYNC_SECONDS = 10
+
+# Market Data: دفتر سفارش محلی (فاصله ذخیره snapshotهای دوره‌ای به جای هر diff)
+MARKET_DATA_ORDER_BOOK_SNAPSHOT_SECONDS = 10
+
+# Market Data: کش داغ آخرین وضعیت بازار ('redis' یا 'memory') + LRU محلی کوتاه‌مدت
+# 'memory' فقط برای یک پروسس است؛ checkpoint_market_state_task در پروسس دیگری اجرا می‌شود و آن را نمی‌بیند
+MARKET_DATA_HOT_CACHE_BACKEND = env_settings('MARKET_DATA_HOT_CACHE_BACKEND', default='redis')
+MARKET_DATA_HOT_CACHE_LOCAL_TTL_MS = 250
+MARKET_DATA_HOT_CACHE_LOCAL_MAX_ENTRIES = 10000
+MARKET_DATA_HOT_CACHE_PRICE_MAX_AGE_MS = 5000
+
+# Market Data: پارتیشن‌بندی زمانی snapshot/tick/order book ('auto'، 'native' یا 'timescale')
+MARKET_DATA_PARTITION_BACKEND = env_settings('MARKET_DATA_PARTITION_BACKEND', default='auto')
+# بازنویسی پیش‌فرض‌های partitioning.DEFAULT_PARTITIONING، مثلاً {'MarketDataTick': {'retention_days': 14}}
+# retention پیش‌فرض خاموش است؛ بدون retention_days هیچ پارتیشنی حذف نمی‌شود
+MARKET_DATA_PARTITIONING = {}
+
+# Market Data: ایندکس پوشش OHLCV (پنجره جستجوی شکاف باید کوتاه‌تر از retention کندل‌ها باشد)
+MARKET_DATA_GAP_SCAN_DAYS = 7
+MARKET_DATA_GAP_BACKFILL_STALE_SECONDS = 3600
+
+# Agents: صف ورودی عامل‌های داده بازار و نویسنده‌های batch (بازنویسی apps.agents.ingest.DEFAULT_AGENT_INGEST)
+# overflow_policy: 'block'، 'drop_newest'، 'drop_oldest' یا 'spill'
+AGENT_INGEST = {}
+AGENT_INGEST_SPILL_DIR = env_settings('AGENT_INGEST_SPILL_DIR', default=os.path.join(BASE_DIR, 'var', 'agent_spill'))
+# Agents: ثبت پس‌زمینه AgentMessage (بازنویسی apps.agents.audit.DEFAULT_AGENT_MESSAGE_AUDIT)
+# سیاست هر topic یا message_type: 'always'، 'sampled:<درصد>'، 'errors' یا 'never'؛ مثال: {'MARKET_DATA_UPDATE': 'sampled:1'}
+AGENT_MESSAGE_AUDIT = {}
+
+# Exchanges: گیت‌وی اجرای سفارش‌های واقعی (manage.py run_execution_gateway؛ بازنویسی apps.exchanges.gateway.DEFAULT_EXECUTION_GATEWAY)
+EXECUTION_GATEWAY = {}
+EXECUTION_GATEWAY_SOCKET = env_settings('EXECUTION_GATEWAY_SOCKET', default=os.path.join(BASE_DIR, 'var', 'execution_gateway.sock'))
+
+# Indicators: کش مشترک نتایج اندیکاتور (LRU درون پروسس + لایه اختیاری Redis)
+INDICATOR_CACHE_MAX_ENTRIES = env_settings.int('INDICATOR_CACHE_MAX_ENTRIES', default=10000)
+INDICATOR_CACHE_MAX_BYTES = env_settings.int('INDICATOR_CACHE_MAX_BYTES', default=64 * 1024 * 1024)
+INDICATOR_CACHE_REDIS_ENABLED = env_settings.bool('INDICATOR_CACHE_REDIS_ENABLED', default=False)
+INDICATOR_CACHE_REDIS_TTL_SECONDS = 24 * 3600
+# عمر نتایج در LRU درون پروسس (ابطال پروسس‌های دیگر به آن نمی‌رسد؛ نتایج کندل باز اصلاً نگه داشته نمی‌شوند)
+INDICATOR_CACHE_LOCAL_TTL_SECONDS = env_settings.int('INDICATOR_CACHE_LOCAL_TTL_SECONDS', default=30)
+
+# Connectors: محدودکننده توکن‌باکت درخواست‌های صرافی ('memory' یا 'redis')
+CONNECTOR_RATE_LIMIT_BACKEND = env_settings('CONNECTOR_RATE_LIMIT_BACKEND', default='memory')
+CONNECTOR_ENDPOINT_WEIGHTS_TTL_SECONDS = 300
+# Connectors: transport مشترک HTTP (استخر اتصال، کش DNS، timeout و retry؛ بازنویسی apps.connectors.transport.DEFAULT_CONNECTOR_HTTP)
+CONNECTOR_HTTP = {}
+# Connectors: استخر کانکتورهای متصل به ازای هر حساب (LRU و بررسی سلامت؛ بازنویسی apps.connectors.pool.DEFAULT_CONNECTOR_POOL)
+CONNECTOR_POOL = {}
+
+# Core: MessageBus بین عامل‌ها ('redis' با Redis Streams و consumer group؛ 'memory' فقط برای مصرف‌کننده‌های همان پروسس)
+MESSAGE_BUS_BACKEND = env_settings('MESSAGE_BUS_BACKEND', default='redis')
+MESSAGE_BUS_CODEC = env_settings('MESSAGE_BUS_CODEC', default='msgpack')
+# بک‌اند پیام‌رسانی عامل‌های runtime که در پروسس‌های جدا اجرا می‌شوند
+AGENT_RUNTIME_BUS_BACKEND = env_settings('AGENT_RUNTIME_BUS_BACKEND', default='redis')
+# اندازه صف‌ها، طول stream، batch و claim پیام‌های pending (بازنویسی apps.core.messaging.DEFAULT_MESSAGE_BUS)
+MESSAGE_BUS = {}
+
+# Backtesting: دیتاست‌های بازپخش تیک/دفتر سفارش (قطعه‌بندی‌شده روی دیسک)
+BACKTEST_REPLAY_CHUNK_SIZE = 250_000
+BACKTEST_REPLAY_BOOK_DEPTH = 20
+
+
 
 ##############################################
 ###  OLD :
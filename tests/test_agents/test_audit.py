@@ -0,0 +1,138 @@
+# tests/test_agents/test_audit.py
+
+import threading
+import uuid
+
+import pytest
+from apps.agents.audit import (
+    DEFAULT_AGENT_MESSAGE_AUDIT, OP_CREATE, OP_PROCESSED, AgentMessageAuditSink, AuditPolicies, parse_policy,
+)
+
+
+class SlowWriter:
+    """
+    Records written rows; can be held to simulate a slow database.
+    """
+
+    def __init__(self):
+        self.batches = []
+        self.threads = set()
+        self.release = threading.Event()
+        self.release.set()
+
+    def __call__(self, records, requeue=None):
+        self.release.wait(5)
+        self.threads.add(threading.current_thread().name)
+        self.batches.append([(record['op'], record['id']) for record in records])
+        return len(records)
+
+    @property
+    def written(self):
+        return [row for batch in self.batches for row in batch]
+
+
+def _sink(writer, tmp_path, **options):
+    options = dict(DEFAULT_AGENT_MESSAGE_AUDIT, spill_dir=str(tmp_path), max_latency_ms=5, **options)
+    return AgentMessageAuditSink(options, writer=writer)
+
+
+class TestAuditPolicies:
+    def test_policy_resolution_and_sampling(self):
+        policies = AuditPolicies({
+            'agent:*': 'sampled:25',
+            'agent:risk*': 'always',
+            'HEARTBEAT': 'never',
+            'MARKET_DATA_*': 'errors',
+        }, default='always')
+        assert policies.resolve('agent:risk-1', 'ORDER_SIGNAL') == ('always', 100.0)
+        assert policies.resolve('agent:7', 'ORDER_SIGNAL') == ('sampled', 25.0)
+        assert policies.resolve('other', 'HEARTBEAT') == ('never', 0.0)
+        assert policies.resolve('other', 'ORDER_SIGNAL') == ('always', 100.0)
+
+        assert not policies.should_record('other', 'MARKET_DATA_UPDATE', payload={'price': '1'})
+        assert policies.should_record('other', 'MARKET_DATA_UPDATE', payload={'error': 'stale book'})
+        assert policies.should_record('other', 'MARKET_DATA_ERROR')
+
+        # تصمیم برای یک correlation_id ثابت است و نرخ آن نزدیک درصد تنظیم‌شده
+        correlations = [str(uuid.uuid4()) for _ in range(4000)]
+        kept = [c for c in correlations if policies.should_record('agent:7', 'ORDER_SIGNAL', c)]
+        assert 0.2 < len(kept) / len(correlations) < 0.3
+        assert all(policies.should_record('agent:7', 'REPLY', c) for c in kept)
+        with pytest.raises(ValueError):
+            parse_policy('sometimes')
+
+
+    def test_uncorrelated_sampling_is_stable_per_message_id(self):
+        policies = AuditPolicies({'agent:*': 'sampled:25'})
+        message_ids = [uuid.uuid4().hex for _ in range(4000)]
+        kept = [m for m in message_ids if policies.should_record('agent:7', 'ORDER_SIGNAL', message_id=m)]
+        assert 0.2 < len(kept) / len(message_ids) < 0.3
+        # record() و mark_processed() برای یک پیام تصمیم یکسان می‌گیرند
+        assert kept == [m for m in message_ids if policies.should_record('agent:7', 'ORDER_SIGNAL', message_id=m)]
+
+
+class TestAgentMessageAuditSink:
+    def test_processed_marker_follows_the_error_decision(self, tmp_path):
+        writer = SlowWriter()
+        sink = _sink(writer, tmp_path, policies={'agent:*': 'errors'})
+        message_id = uuid.uuid4().hex
+        assert sink.record(message_id, 1, 2, 'ORDER_SIGNAL', {}, topic='agent:2', error='rejected')
+        assert not sink.mark_processed(message_id, 'agent:2', 'ORDER_SIGNAL', payload={})
+        assert sink.mark_processed(message_id, 'agent:2', 'ORDER_SIGNAL', payload={}, error='rejected')
+        assert sink.flush()
+        sink.close()
+        assert writer.written == [(OP_CREATE, message_id), (OP_PROCESSED, message_id)]
+
+    def test_rows_are_batched_on_a_background_thread(self, tmp_path):
+        writer = SlowWriter()
+        sink = _sink(writer, tmp_path, policies={'agent:quiet': 'never'})
+        ids = [uuid.uuid4().hex for _ in range(5)]
+        for message_id in ids:
+            assert sink.record(message_id, 1, 2, 'ORDER_SIGNAL', {'qty': 1}, 'corr-1', topic='agent:2')
+        assert not sink.record(uuid.uuid4().hex, 1, 3, 'ORDER_SIGNAL', {}, 'corr-2', topic='agent:quiet')
+        assert sink.mark_processed(ids[0], 'agent:2', 'ORDER_SIGNAL', 'corr-1')
+        assert sink.flush()
+        sink.close()
+        assert writer.written == [(OP_CREATE, message_id) for message_id in ids] + [(OP_PROCESSED, ids[0])]
+        assert all(name.startswith('agent-ingest') for name in writer.threads)
+        assert sink.stats == {'recorded': 5, 'skipped': 1, 'dropped': 0}
+
+    def test_slow_database_spills_to_disk_and_replays(self, tmp_path):
+        writer = SlowWriter()
+        writer.release.clear()
+        sink = _sink(writer, tmp_path, queue_size=2, max_batch_size=2)
+        ids = [uuid.uuid4().hex for _ in range(12)]
+        for message_id in ids:
+            # انتشار هرگز منتظر دیتابیس نمی‌ماند
+            assert sink.record(message_id, 1, 2, 'ORDER_SIGNAL', {}, topic='agent:2')
+        sink.flush(1)
+        assert sink.get_stats()['pipeline']['spilled'] > 0
+        writer.release.set()
+        for _ in range(50):
+            sink.flush()
+            if len(writer.written) == len(ids):
+                break
+            threading.Event().wait(0.05)
+        sink.close()
+        assert [message_id for _, message_id in writer.written] == ids
+        assert sink.stats['dropped'] == 0 and sink.get_stats()['pipeline']['replayed'] > 0
+
+    def test_unmatched_processed_markers_are_requeued(self, tmp_path):
+        calls = []
+
+        def writer(records, requeue=None):
+            calls.extend((record['op'], record.get('attempts', 0)) for record in records)
+            # ردیف پیام در پروسس دیگری هنوز نوشته نشده است
+            requeue([record for record in records if record['op'] == OP_PROCESSED])
+            return len(records)
+
+        sink = _sink(writer, tmp_path, marker_retries=2, marker_retry_seconds=0.01)
+        assert sink.mark_processed(uuid.uuid4().hex, 'agent:2', 'ORDER_SIGNAL', 'corr-1')
+        for _ in range(100):
+            sink.flush()
+            if len(calls) == 3:
+                break
+            threading.Event().wait(0.02)
+        threading.Event().wait(0.05)
+        sink.close()
+        assert calls == [(OP_PROCESSED, 0), (OP_PROCESSED, 1), (OP_PROCESSED, 2)]
@@ -0,0 +1,173 @@
+# tests/test_agents/test_ingest.py
+
+import asyncio
+import threading
+from datetime import datetime, timezone
+
+import pytest
+from apps.agents.ingest import DEFAULT_AGENT_INGEST, KIND_SNAPSHOT, AgentIngestPipeline, write_snapshots
+
+
+def _options(**overrides):
+    options = dict(DEFAULT_AGENT_INGEST, writers=1, queue_size=4, max_batch_size=3, max_latency_ms=5,
+                   metrics_flush_seconds=3600, close_timeout_seconds=5)
+    options.update(overrides)
+    return options
+
+
+class RecordingWriter:
+    """
+    Records written batches; can be held to simulate a slow database.
+    """
+
+    def __init__(self):
+        self.batches = []
+        self.threads = set()
+        self.release = threading.Event()
+        self.release.set()
+
+    def __call__(self, records):
+        self.release.wait(5)
+        self.threads.add(threading.current_thread().name)
+        self.batches.append([record['seq'] for record in records])
+        return len(records)
+
+    @property
+    def written(self):
+        return [seq for batch in self.batches for seq in batch]
+
+
+def _pipeline(writer, counts=None, **options):
+    return AgentIngestPipeline(
+        'agent-1', _options(**options), writers={KIND_SNAPSHOT: writer},
+        metric_writer=lambda agent_id, received, errors, ms: (counts if counts is not None else []).append((received, errors)),
+    )
+
+
+def _record(seq, config_id='c1'):
+    return {'config_id': config_id, 'seq': seq}
+
+
+class TestAgentIngestPipeline:
+    def test_records_are_batched_off_the_event_loop_in_order(self):
+        writer, counts = RecordingWriter(), []
+
+        async def scenario():
+            pipeline = _pipeline(writer, counts, queue_size=100, writers=2)
+            await pipeline.start()
+            for seq in range(7):
+                assert await pipeline.submit(KIND_SNAPSHOT, _record(seq))
+                pipeline.count_message(1.0)
+            await pipeline.close()
+            return pipeline.get_stats()
+
+        stats = asyncio.run(scenario())
+        assert writer.written == list(range(7))
+        assert max(len(batch) for batch in writer.batches) == 3
+        assert all(name.startswith('agent-ingest') for name in writer.threads)
+        assert stats['written'] == 7 and stats['queue_depth'] == 0
+        assert counts == [(7, 0)]
+
+    def test_block_policy_applies_backpressure(self):
+        writer = RecordingWriter()
+        writer.release.clear()
+
+        async def scenario():
+            pipeline = _pipeline(writer, queue_size=2, max_batch_size=1)
+            await pipeline.start()
+            for seq in range(3):
+                await pipeline.submit(KIND_SNAPSHOT, _record(seq))
+            # نویسنده مشغول است و صف پر؛ ورودی بعدی منتظر می‌ماند
+            blocked = asyncio.create_task(pipeline.submit(KIND_SNAPSHOT, _record(3)))
+            await asyncio.sleep(0.05)
+            assert not blocked.done()
+            writer.release.set()
+            assert await asyncio.wait_for(blocked, 5)
+            await pipeline.close()
+            return pipeline.get_stats()
+
+        stats = asyncio.run(scenario())
+        assert writer.written == [0, 1, 2, 3] and stats['dropped'] == 0
+
+    def test_drop_policies(self):
+        for policy, expected in (('drop_newest', [0, 1, 2]), ('drop_oldest', [0, 3, 4])):
+            writer = RecordingWriter()
+            writer.release.clear()
+
+            async def scenario():
+                pipeline = _pipeline(writer, queue_size=2, max_batch_size=1, overflow_policy=policy)
+                await pipeline.start()
+                await pipeline.submit(KIND_SNAPSHOT, _record(0))
+                await asyncio.sleep(0.02)  # رکورد 0 در دست نویسنده است
+                results = [await pipeline.submit(KIND_SNAPSHOT, _record(seq)) for seq in range(1, 5)]
+                writer.release.set()
+                await pipeline.close()
+                return results, pipeline.get_stats()
+
+            results, stats = asyncio.run(scenario())
+            assert writer.written == expected, policy
+            assert stats['dropped'] == 2
+            assert results == ([True, True, False, False] if policy == 'drop_newest' else [True] * 4)
+
+    def test_spill_keeps_order_and_replays_from_disk(self, tmp_path):
+        writer = RecordingWriter()
+        writer.release.clear()
+
+        async def scenario():
+            pipeline = _pipeline(writer, queue_size=2, max_batch_size=2, overflow_policy='spill', spill_dir=str(tmp_path))
+            await pipeline.start()
+            await pipeline.submit(KIND_SNAPSHOT, _record(0))
+            await asyncio.sleep(0.02)
+            for seq in range(1, 9):
+                assert await pipeline.submit(KIND_SNAPSHOT, _record(seq))
+            await asyncio.sleep(0.05)
+            assert pipeline.get_stats()['spill_segments'] >= 1
+            writer.release.set()
+            for _ in range(200):
+                stats = pipeline.get_stats()
+                if stats['written'] == 9:
+                    break
+                await asyncio.sleep(0.01)
+            await pipeline.close()
+            return pipeline.get_stats()
+
+        stats = asyncio.run(scenario())
+        assert writer.written == list(range(9))
+        assert stats['spilled'] > 0 and stats['replayed'] == stats['spilled'] and stats['dropped'] == 0
+        assert list(tmp_path.rglob('*.jsonl')) == []
+
+
+@pytest.mark.django_db
+class TestWriteSnapshots:
+    def test_newest_row_per_config_goes_to_hot_cache(self, mocker, settings, tmp_path):
+        from tests.test_market_data.factories import MarketDataConfigFactory
+
+        settings.MARKET_DATA_COLUMNAR_ROOT = str(tmp_path)
+        cache_snapshot = mocker.patch('apps.market_data.services.MarketDataService.cache_snapshot')
+        config = MarketDataConfigFactory(data_type='OHLCV', timeframe='1m')
+        base = int(datetime(2024, 3, 4, tzinfo=timezone.utc).timestamp() * 1000)
+        candle = {'open': '1', 'high': '2', 'low': '1', 'close': '2', 'volume': '5'}
+        records = [dict(candle, config_id=str(config.id), timestamp=base + minute * 60_000) for minute in (2, 0, 1)]
+
+        assert write_snapshots(records) == 3
+        # bulk_create سیگنال post_save را اجرا نمی‌کند؛ کش فقط با جدیدترین کندل به‌روز می‌شود
+        cache_snapshot.assert_called_once()
+        assert cache_snapshot.call_args.args[0].timestamp == datetime(2024, 3, 4, 0, 2, tzinfo=timezone.utc)
+
+    def test_post_persist_hooks_run_once_per_config(self, mocker):
+        from tests.test_market_data.factories import MarketDataConfigFactory
+
+        run_hooks = mocker.patch('apps.market_data.services.MarketDataService.run_snapshot_hooks')
+        first = MarketDataConfigFactory(data_type='OHLCV', timeframe='1m')
+        second = MarketDataConfigFactory(data_type='OHLCV', timeframe='1m')
+        base = int(datetime(2024, 3, 4, tzinfo=timezone.utc).timestamp() * 1000)
+        candle = {'open': '1', 'high': '2', 'low': '1', 'close': '2', 'volume': '5'}
+        records = [dict(candle, config_id=str(config.id), timestamp=base + minute * 60_000)
+                   for minute in (1, 0) for config in (first, second)]
+
+        assert write_snapshots(records) == 4
+        assert run_hooks.call_count == 2
+        for call in run_hooks.call_args_list:
+            config, rows = call.args
+            assert {row.config_id for row in rows} == {config.id}
+            assert len(rows) == 2
@@ -0,0 +1,96 @@
+# tests/test_backtesting/test_event_driven.py
+
+import numpy as np
+import pytest
+from apps.backtesting.event_driven import (
+    BookEvent,
+    EventDrivenBacktester,
+    MatchingSimulator,
+    ORDER_LIMIT,
+    SimOrder,
+    TickEvent,
+)
+from apps.backtesting.replay import TICK_DTYPE, TICK_SIDE_BUY, TICK_SIDE_SELL, ReplayDataset
+
+MINUTE_MS = 60_000
+
+
+def _dataset(tmp_path, prices, chunk_size=4):
+    dataset = ReplayDataset('test', 0, len(prices) * MINUTE_MS, root=str(tmp_path), depth=2)
+    dataset.reset()
+    ticks = np.zeros(len(prices), dtype=TICK_DTYPE)
+    ticks['timestamp'] = np.arange(len(prices)) * MINUTE_MS
+    ticks['price'] = prices
+    ticks['quantity'] = 1.0
+    ticks['side'] = TICK_SIDE_BUY
+    for index, start in enumerate(range(0, len(prices), chunk_size)):
+        dataset.write_tick_chunk(index, ticks[start:start + chunk_size])
+    dataset.mark_complete()
+    return dataset
+
+
+class TestMatchingSimulator:
+    def test_market_order_walks_depth(self):
+        matcher = MatchingSimulator()
+        matcher.on_book(BookEvent(0, [[99.0, 1.0]], [[100.0, 1.0], [101.0, 2.0]]))
+        fills = matcher.submit(SimOrder('O1', 'BUY', 2.0), 0)
+        assert [(f.price, f.quantity) for f in fills] == [(100.0, 1.0), (101.0, 1.0)]
+
+    def test_market_order_partially_filled_when_depth_is_short(self):
+        matcher = MatchingSimulator()
+        matcher.on_book(BookEvent(0, [], [[100.0, 1.0]]))
+        order = SimOrder('O1', 'BUY', 3.0)
+        matcher.submit(order, 0)
+        assert order.filled == 1.0 and order.is_active
+        matcher.on_book(BookEvent(1, [], [[100.5, 5.0]]))
+        assert order.filled == 3.0 and not order.is_active
+
+    def test_limit_order_waits_for_queue_ahead(self):
+        matcher = MatchingSimulator()
+        matcher.on_book(BookEvent(0, [[99.0, 5.0]], [[100.0, 1.0]]))
+        order = SimOrder('O1', 'BUY', 2.0, ORDER_LIMIT, 99.0)
+        assert matcher.submit(order, 0) == []
+        assert order.queue_ahead == 5.0
+
+        assert matcher.on_trade(TickEvent(1, 99.0, 4.0, TICK_SIDE_SELL)) == []
+        fills = matcher.on_trade(TickEvent(2, 99.0, 2.0, TICK_SIDE_SELL))
+        assert [(f.price, f.quantity) for f in fills] == [(99.0, 1.0)]
+        # معامله زیر قیمت لیمیت، باقیمانده را کامل پر می‌کند
+        fills = matcher.on_trade(TickEvent(3, 98.5, 3.0, TICK_SIDE_SELL))
+        assert sum(f.quantity for f in fills) == 1.0
+        assert order.status == 'FILLED'
+
+
+class TestEventDrivenBacktester:
+    def test_replay_streams_chunks_and_trades(self, tmp_path):
+        prices = [100, 101, 102, 103, 104, 105, 104, 103, 102, 101, 100]
+        backtester = EventDrivenBacktester(
+            _dataset(tmp_path, prices),
+            '1m',
+            run_parameters={
+                'entry_conditions': [{'left': 'close', 'op': '>=', 'right': 102}],
+                'exit_conditions': [{'left': 'close', 'op': '<', 'right': 103}],
+            },
+            initial_capital=1000,
+        )
+        outcome = backtester.run()
+
+        assert outcome.summary['events'] >= len(prices)
+        assert outcome.trade_count == 1
+        assert outcome.trades['exit_reason'].tolist() == ['signal']
+        assert outcome.equity[-1] == pytest.approx(1000 + outcome.trades['pnl'].sum())
+
+    def test_trailing_stop_exits_on_retracement(self, tmp_path):
+        prices = [100, 100, 110, 120, 119, 117, 116, 115]
+        backtester = EventDrivenBacktester(
+            _dataset(tmp_path, prices),
+            '1h', # کندل‌ها بسته نمی‌شوند؛ فقط حد ضرر متحرک خروج را ایجاد می‌کند
+            initial_capital=1000,
+            trailing_stop_config={'activation_percent': 5, 'trail_percent': 2},
+        )
+        backtester.portfolio.cash = 1000
+        backtester._entry_order = backtester._submit('BUY', 10.0, 0, 'entry')
+        outcome = backtester.run()
+
+        assert outcome.trades['exit_reason'].tolist() == ['trailing_stop']
+        assert outcome.trades['exit_price'][0] == pytest.approx(117) # اولین قیمت زیر 120 * 0.98
@@ -0,0 +1,131 @@
+# tests/test_backtesting/test_optimization.py
+
+import numpy as np
+import pytest
+from apps.backtesting.exceptions import BacktestConfigurationError
+from apps.backtesting.optimization import (
+    ParameterSpace,
+    SharedMarketData,
+    SweepExecutor,
+    replay_steps,
+    search,
+    search_steps,
+    split_batches,
+    walk_forward_windows,
+)
+from apps.market_data.storage import OHLCVArrays
+
+SCHEMA = {
+    'fast': {'type': 'int', 'min': 5, 'max': 15, 'step': 5},
+    'slow': {'type': 'int', 'values': [30, 60]},
+    'label': {'type': 'string'}, # بدون بازه -> قابل تنظیم نیست
+}
+
+
+def _bars(count=3000, seed=3):
+    rng = np.random.default_rng(seed)
+    closes = 100 + np.cumsum(rng.normal(0, 0.5, count))
+    return OHLCVArrays(
+        timestamp=np.arange(count, dtype=np.int64) * 3_600_000,
+        open_price=closes,
+        high_price=closes + 0.5,
+        low_price=closes - 0.5,
+        close_price=closes,
+        volume=np.ones(count),
+    )
+
+
+def _job_template(shared, early_stopping=None):
+    return {
+        'data_path': shared.path,
+        'early_stopping': early_stopping,
+        'spec': {
+            'indicator_configs': [{'code': 'SMA', 'alias': 'fast', 'params': {'period': '$fast'}},
+                                  {'code': 'SMA', 'alias': 'slow', 'params': {'period': '$slow'}}],
+            'base_parameters': {
+                'entry_conditions': [{'left': 'fast', 'op': 'crosses_above', 'right': 'slow'}],
+                'exit_conditions': [{'left': 'fast', 'op': 'crosses_below', 'right': 'slow'}],
+            },
+            'timeframe': '1h',
+        },
+    }
+
+
+class TestParameterSpace:
+    def test_grid_expansion(self):
+        space = ParameterSpace(SCHEMA)
+        assert space.names == ['fast', 'slow']
+        assert space.grid_size() == 6
+        assert {'fast': 10, 'slow': 60} in list(space.grid())
+
+    def test_json_schema_properties(self):
+        space = ParameterSpace({'properties': {'mult': {'type': 'number', 'minimum': 1, 'maximum': 2, 'multipleOf': 0.5}}})
+        assert [p['mult'] for p in space.grid()] == [1.0, 1.5, 2.0]
+
+    def test_schema_without_ranges_is_rejected(self):
+        with pytest.raises(BacktestConfigurationError):
+            ParameterSpace({'label': {'type': 'string'}})
+
+    def test_unit_round_trip(self):
+        space = ParameterSpace(SCHEMA)
+        params = {'fast': 10, 'slow': 60}
+        assert space.from_unit(space.to_unit(params)) == params
+
+
+class TestSearch:
+    def test_grid_search_ranks_all_combinations(self, tmp_path):
+        shared = SharedMarketData.create(_bars(), root=str(tmp_path))
+        with SweepExecutor('serial') as executor:
+            ranked = search(ParameterSpace(SCHEMA), executor, _job_template(shared), 'grid', objective='total_return_pct')
+        returns = [result['summary']['total_return_pct'] for result in ranked]
+        assert len(ranked) == 6
+        assert returns == sorted(returns, reverse=True)
+        assert ranked[0]['rank'] == 1
+
+    def test_bayesian_search_respects_budget(self, tmp_path):
+        shared = SharedMarketData.create(_bars(), root=str(tmp_path))
+        schema = {'fast': {'type': 'int', 'min': 2, 'max': 40}, 'slow': {'type': 'int', 'min': 41, 'max': 120}}
+        with SweepExecutor('serial', max_workers=2) as executor:
+            ranked = search(ParameterSpace(schema), executor, _job_template(shared), 'bayesian', n_iter=16, seed=1, n_startup=6)
+        assert len(ranked) == 16
+        assert len({tuple(sorted(r['parameters'].items())) for r in ranked}) == 16
+
+    def test_early_stopping_prunes_losing_sets(self, tmp_path):
+        shared = SharedMarketData.create(_bars(), root=str(tmp_path))
+        early_stopping = {'probe_fraction': 0.25, 'min_return_pct': 1e9} # همه مجموعه‌ها «بازنده» هستند
+        with SweepExecutor('serial') as executor:
+            ranked = search(ParameterSpace(SCHEMA), executor, _job_template(shared, early_stopping), 'grid')
+        assert all(result['pruned'] for result in ranked)
+        assert all(result['score'] is None for result in ranked)
+
+
+class TestSweepRounds:
+    def test_replaying_recorded_rounds_resumes_the_search(self, tmp_path):
+        shared = SharedMarketData.create(_bars(), root=str(tmp_path))
+        schema = {'fast': {'type': 'int', 'min': 5, 'max': 40}, 'slow': {'type': 'int', 'min': 50, 'max': 200}}
+        space, template = ParameterSpace(schema), _job_template(shared)
+        with SweepExecutor('serial', max_workers=2) as executor:
+            expected = search(space, executor, template, 'bayesian', n_iter=8, seed=4, n_startup=4)
+
+            # هر دور مانند callback یک chord از نو بازپخش می‌شود
+            rounds = []
+            while True:
+                done, value = replay_steps(search_steps(space, template, 'bayesian', 8, seed=4, n_startup=4, batch_size=2), rounds)
+                if done:
+                    break
+                rounds.append(executor.map(value))
+        assert len(rounds) == 4
+        assert [result['parameters'] for result in value] == [result['parameters'] for result in expected]
+
+    def test_split_batches(self):
+        batches = split_batches([{'n': i} for i in range(10)], max_workers=1)
+        assert [len(batch) for batch in batches] == [3, 3, 3, 1]
+
+
+class TestWalkForward:
+    def test_windows_roll_by_step(self):
+        timestamps = np.arange(0, 100 * 86_400_000, 3_600_000, dtype=np.int64)
+        windows = walk_forward_windows(timestamps, train_days=30, test_days=10)
+        assert windows[0]['test_start_ms'] == windows[0]['train_end_ms'] + 1
+        assert windows[1]['train_start_ms'] - windows[0]['train_start_ms'] == 10 * 86_400_000
+        assert windows[-1]['test_end_ms'] <= timestamps[-1]
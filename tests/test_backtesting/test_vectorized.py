@@ -0,0 +1,92 @@
+# tests/test_backtesting/test_vectorized.py
+
+import numpy as np
+import pytest
+from apps.backtesting.exceptions import BacktestConfigurationError
+from apps.backtesting.vectorized import (
+    build_features,
+    evaluate_conditions,
+    run_vectorized_backtest,
+    simulate,
+    target_position,
+)
+from apps.market_data.storage import OHLCVArrays
+
+
+def _bars(closes):
+    closes = np.asarray(closes, dtype=float)
+    return OHLCVArrays(
+        timestamp=np.arange(len(closes), dtype=np.int64) * 60_000,
+        open_price=closes.copy(),
+        high_price=closes + 1,
+        low_price=closes - 1,
+        close_price=closes,
+        volume=np.ones(len(closes)),
+    )
+
+
+class TestSignals:
+    def test_target_position_from_entries_and_exits(self):
+        entries = np.array([0, 1, 0, 0, 1, 0, 0], dtype=bool)
+        exits = np.array([0, 0, 0, 1, 0, 0, 1], dtype=bool)
+        assert target_position(entries, exits).tolist() == [False, True, True, False, True, True, False]
+
+    def test_crosses_above_uses_previous_bar(self):
+        features = {'close': np.array([1.0, 2.0, 3.0, 2.0, 4.0]), 'level': np.full(5, 2.5)}
+        fired = evaluate_conditions(features, [{'left': 'close', 'op': 'crosses_above', 'right': 'level'}])
+        assert fired.tolist() == [False, False, True, False, True]
+
+    def test_parameter_references_are_resolved(self):
+        bars = _bars(np.arange(30) + 100)
+        features = build_features(bars, [{'code': 'SMA', 'alias': 'sma', 'params': {'period': '$n'}}], run_parameters={'n': 5})
+        assert np.isnan(features['sma'][3])
+        assert features['sma'][4] == pytest.approx(102.0)
+
+    def test_unknown_series_raises(self):
+        with pytest.raises(BacktestConfigurationError):
+            evaluate_conditions({'close': np.ones(3)}, [{'left': 'ema', 'op': '>', 'right': 1}])
+
+
+class TestSimulation:
+    def test_fill_on_next_open_with_costs(self):
+        bars = _bars([100, 100, 110, 120, 120])
+        target = np.array([True, True, False, False, False])
+        outcome = simulate(bars, target, runtime_config={'commission': 0.001, 'slippage': 0.0}, initial_capital=1000)
+
+        assert outcome.trade_count == 1
+        assert outcome.trades['entry_index'].tolist() == [1]
+        assert outcome.trades['exit_index'].tolist() == [3]
+        quantity = 1000 / 100
+        expected_pnl = quantity * (120 - 100) - 0.001 * quantity * (100 + 120)
+        assert outcome.trades['pnl'][0] == pytest.approx(expected_pnl)
+        assert outcome.equity[-1] == pytest.approx(1000 + expected_pnl)
+
+    def test_open_position_closed_at_end(self):
+        bars = _bars([100, 100, 105, 110])
+        outcome = simulate(bars, np.array([True, True, True, True]), initial_capital=1000)
+        assert outcome.trades['exit_reason'].tolist() == ['end_of_data']
+        assert outcome.summary['final_equity'] == pytest.approx(1100)
+
+    def test_short_direction_profits_on_decline(self):
+        bars = _bars([100, 100, 90, 80])
+        outcome = simulate(bars, np.array([True, True, False, False]), direction='short', initial_capital=1000)
+        assert outcome.trades['pnl'][0] == pytest.approx(10 * (100 - 80))
+
+    def test_equity_curve_matches_trade_pnl(self):
+        rng = np.random.default_rng(1)
+        bars = _bars(100 + np.cumsum(rng.normal(0, 1, 500)))
+        outcome = run_vectorized_backtest(
+            bars,
+            indicator_configs=[{'code': 'SMA', 'alias': 'fast', 'params': {'period': 5}},
+                               {'code': 'SMA', 'alias': 'slow', 'params': {'period': 20}}],
+            run_parameters={
+                'entry_conditions': [{'left': 'fast', 'op': 'crosses_above', 'right': 'slow'}],
+                'exit_conditions': [{'left': 'fast', 'op': 'crosses_below', 'right': 'slow'}],
+            },
+            runtime_config={'commission_bps': 10, 'slippage_bps': 5},
+            initial_capital=10_000,
+            timeframe='1m',
+        )
+        assert outcome.trade_count > 0
+        assert outcome.equity[-1] == pytest.approx(10_000 + outcome.trades['pnl'].sum())
+        assert outcome.summary['num_trades'] == outcome.trade_count
@@ -0,0 +1,95 @@
+# tests/test_connectors/test_pool.py
+
+import threading
+from types import SimpleNamespace
+
+from apps.connectors.pool import DEFAULT_CONNECTOR_POOL, ConnectorPool, credentials_fingerprint
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeConnector:
+    def __init__(self, account, healthy=True):
+        self.account = account
+        self.healthy = healthy
+        self.connected = True
+
+    def health_check(self):
+        return self.healthy
+
+    def disconnect(self):
+        self.connected = False
+
+
+def _account(account_id, key='k1'):
+    return SimpleNamespace(pk=account_id, id=account_id, exchange_id=1, _api_key_encrypted=key,
+                           _api_secret_encrypted='s1', encrypted_key_iv='iv')
+
+
+def _pool(**options):
+    created, clock = [], FakeClock()
+
+    def factory(account):
+        connector = FakeConnector(account)
+        created.append(connector)
+        return connector
+
+    pool = ConnectorPool(dict(DEFAULT_CONNECTOR_POOL, **options), factory=factory, account_loader=_account,
+                         clock=clock, start_maintenance=False)
+    return pool, created, clock
+
+
+class TestConnectorPool:
+    def test_connectors_are_reused_and_evicted_lru(self):
+        pool, created, _ = _pool(max_connections=2)
+        first = pool.get(_account(1))
+        assert pool.get(1) is first and pool.get(_account(1)) is first
+        pool.get(_account(2))
+        pool.get(1)  # حساب ۱ اخیراً استفاده شده؛ حساب ۲ قدیمی‌ترین است
+        pool.get(_account(3))
+        assert 2 not in pool and 1 in pool and 3 in pool
+        assert created[1].connected is False and first.connected
+        assert pool.get_stats()['hits'] == 3 and pool.get_stats()['evictions'] == 1
+
+    def test_credential_changes_rebuild_the_connector(self):
+        pool, created, _ = _pool()
+        old = pool.get(_account(1, key='k1'))
+        new = pool.get(_account(1, key='k2'))
+        assert new is not old and old.connected is False
+        # تغییر در پروسس دیگر: مقایسه fingerprint با دیتابیس
+        assert pool.refresh_credentials({'1': credentials_fingerprint(_account(1, key='k3'))}) == 1
+        assert 1 not in pool and new.connected is False
+        assert pool.invalidate(1) is False
+
+    def test_idle_connectors_are_health_checked_and_expired(self):
+        pool, created, clock = _pool(idle_check_seconds=60, max_idle_seconds=600)
+        healthy, sick, stale = pool.get(1), pool.get(2), pool.get(3)
+        sick.healthy = False
+        clock.now += 700
+        pool.get(1), pool.get(2)
+        clock.now += 100
+        assert pool.check_idle() == {'expired': 1, 'checked': 2, 'unhealthy': 1}
+        assert 1 in pool and 2 not in pool and 3 not in pool
+        assert stale.connected is False and sick.connected is False and healthy.connected
+
+    def test_concurrent_misses_connect_once(self):
+        pool, created, _ = _pool()
+        barrier = threading.Barrier(8)
+        results = []
+
+        def worker():
+            barrier.wait()
+            results.append(pool.get(7))
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(created) == 1 and all(result is created[0] for result in results)
@@ -0,0 +1,103 @@
+# tests/test_connectors/test_rate_limiter.py
+
+import asyncio
+
+import pytest
+from apps.connectors.rate_limiter import (
+    BucketSpec,
+    InMemoryRateLimiterBackend,
+    RateLimitConfigurationError,
+    RateLimiter,
+    account_bucket_key,
+    parse_account_bucket_key,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class CountingRateLimiter(RateLimiter):
+    loads = 0
+
+    def _load_endpoint_weights(self, exchange_id):
+        CountingRateLimiter.loads += 1
+        return {('/api/v3/order', 'POST'): 5, ('/api/v3/order', None): 5, ('/api/v3/depth', None): 10}
+
+
+class TestInMemoryBackend:
+    def test_exact_wait_until_refill(self):
+        clock = FakeClock()
+        backend = InMemoryRateLimiterBackend(clock=clock)
+        specs = [BucketSpec('b', capacity=10, refill_per_second=2, cost=4)]
+        assert backend.try_acquire(specs) == 0.0
+        assert backend.try_acquire(specs) == 0.0
+        # 2 توکن باقی مانده؛ برای 4 توکن باید 1 ثانیه صبر کرد
+        assert backend.try_acquire(specs) == pytest.approx(1.0)
+        clock.now += 1.0
+        assert backend.try_acquire(specs) == 0.0
+
+    def test_multi_bucket_is_all_or_nothing(self):
+        clock = FakeClock()
+        backend = InMemoryRateLimiterBackend(clock=clock)
+        ip = BucketSpec('ip', capacity=10, refill_per_second=1, cost=3)
+        account = BucketSpec('acct', capacity=1, refill_per_second=1, cost=1)
+        assert backend.try_acquire([ip, account]) == 0.0
+        assert backend.try_acquire([ip, account]) == pytest.approx(1.0)
+        # باکت IP در تلاش ناموفق مصرف نشده است
+        assert backend.snapshot()['ip'][0] == pytest.approx(7.0)
+
+    def test_refill_is_capped_at_capacity(self):
+        clock = FakeClock()
+        backend = InMemoryRateLimiterBackend(clock=clock)
+        specs = [BucketSpec('b', capacity=5, refill_per_second=1, cost=5)]
+        backend.try_acquire(specs)
+        clock.now += 100
+        assert backend.snapshot()['b'] == (5.0, 5.0)
+
+    def test_cost_larger_than_capacity_is_rejected(self):
+        with pytest.raises(RateLimitConfigurationError):
+            BucketSpec('b', capacity=2, refill_per_second=1, cost=3)
+
+
+class TestRateLimiter:
+    def test_endpoint_weights_loaded_once_per_exchange(self):
+        CountingRateLimiter.loads = 0
+        limiter = CountingRateLimiter(backend=InMemoryRateLimiterBackend(), weights_ttl_seconds=300)
+        assert limiter.get_endpoint_weight(1, '/api/v3/order', 'post') == 5
+        assert limiter.get_endpoint_weight(1, '/api/v3/depth') == 10
+        assert limiter.get_endpoint_weight(1, '/unknown') == 1
+        assert CountingRateLimiter.loads == 1
+        limiter.invalidate_endpoint_weights(1)
+        limiter.get_endpoint_weight(1, '/api/v3/order')
+        assert CountingRateLimiter.loads == 2
+
+    def test_acquire_sleeps_for_exact_wait(self):
+        limiter = RateLimiter(backend=InMemoryRateLimiterBackend())
+        specs = [BucketSpec('b', capacity=1, refill_per_second=50, cost=1)]
+        assert limiter.acquire(specs)
+        assert limiter.try_acquire(specs) > 0
+        assert limiter.acquire(specs, timeout=1.0)
+        assert not limiter.acquire(specs, timeout=0.0)
+
+    def test_acquire_async(self):
+        limiter = RateLimiter(backend=InMemoryRateLimiterBackend())
+        specs = [BucketSpec('b', capacity=2, refill_per_second=100, cost=1)]
+
+        async def burst():
+            return await asyncio.gather(*(limiter.acquire_async(specs) for _ in range(5)))
+
+        assert asyncio.run(burst()) == [True] * 5
+
+    def test_snapshot_reports_account_buckets(self):
+        clock = FakeClock()
+        limiter = RateLimiter(backend=InMemoryRateLimiterBackend(clock=clock))
+        specs = limiter.bucket_specs(7, 42, '/api/v3/order', weight=5, ip_weight_per_minute=1200, account_requests_per_second=10)
+        limiter.try_acquire(specs)
+        rows = limiter.snapshot()
+        assert rows == [{'exchange_account_id': '42', 'endpoint_path': '/api/v3/order', 'tokens': 9.0, 'capacity': 10.0}]
+        assert parse_account_bucket_key(account_bucket_key(42, '/a:b')) == ('42', '/a:b')
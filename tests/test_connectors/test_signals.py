@@ -0,0 +1,33 @@
+# tests/test_connectors/test_signals.py
+
+import pytest
+
+from apps.connectors import signals  # noqa: F401 (ثبت receiverها)
+from tests.test_exchanges.factories import ExchangeAccountFactory, ExchangeFactory
+
+
+@pytest.mark.django_db
+class TestPooledConnectorInvalidation:
+    def test_only_deactivation_and_key_or_exchange_changes_invalidate(self, mocker):
+        account = ExchangeAccountFactory(is_active=True)
+        invalidate = mocker.patch('apps.connectors.signals.connector_pool.invalidate')
+
+        # همگام‌سازی حساب (sync_exchange_account) فیلدهای کانکتور را تغییر نمی‌دهد
+        account.account_info = {'tier': 'vip1'}
+        account.save(update_fields=['account_info', 'trading_permissions', 'last_sync_at'])
+        account.label = 'renamed'
+        account.save()
+        invalidate.assert_not_called()
+
+        account.api_key = 'rotated_key'
+        account.save()
+        account.exchange = ExchangeFactory()
+        account.save(update_fields=['exchange'])
+        account.is_active = False
+        account.save(update_fields=['is_active'])
+        assert invalidate.call_count == 3
+
+        # فعال‌سازی دوباره کانکتوری در pool ندارد که باید حذف شود
+        account.is_active = True
+        account.save()
+        assert invalidate.call_count == 3
@@ -0,0 +1,117 @@
+# tests/test_connectors/test_transport.py
+
+import asyncio
+
+import pytest
+from apps.connectors.rate_limiter import BucketSpec
+from apps.connectors.transport import DEFAULT_CONNECTOR_HTTP, HttpTransport
+from apps.exchanges.exceptions import ConnectorError, ExchangeConnectionError
+
+
+class FakeResponse:
+    def __init__(self, status, body=b'{}', headers=None):
+        self.status = status
+        self.headers = headers or {}
+        self._body = body
+
+    async def read(self):
+        return self._body
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+
+class FakeSession:
+    """
+    Replays scripted outcomes (a status code, a FakeResponse or an exception) and records requests.
+    """
+
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.requests = []
+        self.closed = False
+
+    def request(self, method, url, **kwargs):
+        self.requests.append((method, url, kwargs))
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome if isinstance(outcome, FakeResponse) else FakeResponse(outcome)
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeLimiter:
+    def __init__(self):
+        self.acquired = 0
+
+    async def acquire_async(self, specs, timeout=None):
+        self.acquired += 1
+        return True
+
+
+def _transport(outcomes, **options):
+    session, limiter, sleeps = FakeSession(outcomes), FakeLimiter(), []
+
+    async def sleep(delay):
+        sleeps.append(delay)
+
+    transport = HttpTransport(dict(DEFAULT_CONNECTOR_HTTP, **options), session_factory=lambda: session,
+                              rate_limiter=limiter, sleep=sleep)
+    return transport, session, limiter, sleeps
+
+
+SPECS = [BucketSpec('ip', 1200, 20, 5)]
+
+
+class TestHttpTransport:
+    def test_idempotent_requests_retry_with_rate_limit_per_attempt(self):
+        transport, session, limiter, sleeps = _transport(
+            [FakeResponse(429, headers={'Retry-After': '1.5'}), 503, FakeResponse(200, b'{"serverTime": 1}')])
+        response = asyncio.run(transport.request('get', 'https://api.test/api/v3/time', rate_limit=SPECS))
+        assert response.json() == {'serverTime': 1} and response.attempts == 3
+        assert limiter.acquired == 3 and sleeps[0] == 1.5 and len(sleeps) == 2
+        # جلسه یک بار ساخته و برای همه تلاش‌ها استفاده می‌شود
+        assert len(session.requests) == 3 and transport.stats['retries'] == 2
+
+    def test_orders_are_retried_only_with_an_idempotency_key(self):
+        transport, session, _, _ = _transport([503, asyncio.TimeoutError()])
+        first = asyncio.run(transport.request('POST', 'https://api.test/api/v3/order', data={'symbol': 'BTCUSDT'}))
+        assert first.status == 503 and len(session.requests) == 1
+        with pytest.raises(ConnectorError):
+            first.raise_for_status()
+        with pytest.raises(ExchangeConnectionError):
+            asyncio.run(transport.request('POST', 'https://api.test/api/v3/order', data={'symbol': 'BTCUSDT'}))
+        assert len(session.requests) == 2
+
+        transport, session, _, _ = _transport([asyncio.TimeoutError(), 200])
+        signed = []
+
+        def prepare(parts):
+            signed.append(parts['data']['newClientOrderId'])
+            return dict(parts, data=dict(parts['data'], signature=f"sig-{len(signed)}"))
+
+        response = asyncio.run(transport.request(
+            'POST', 'https://api.test/api/v3/order', data={'symbol': 'BTCUSDT'},
+            idempotency_key='bot-1-42', idempotency_param='newClientOrderId', prepare=prepare))
+        assert response.status == 200 and signed == ['bot-1-42', 'bot-1-42']
+        assert [kwargs['data']['signature'] for _, _, kwargs in session.requests] == ['sig-1', 'sig-2']
+
+    def test_unsent_requests_are_always_retried(self):
+        transport, session, _, _ = _transport([ConnectionRefusedError(), 201], max_retries=1)
+        response = asyncio.run(transport.request('POST', 'https://api.test/v2/create_order.do', data={'amount': '1'}))
+        assert response.status == 201 and len(session.requests) == 2
+
+    def test_idempotency_header_and_close(self):
+        transport, session, _, _ = _transport([200])
+
+        async def scenario():
+            await transport.request('DELETE', 'https://api.test/api/v3/order', idempotency_key='k-1')
+            await transport.close()
+
+        asyncio.run(scenario())
+        assert session.requests[0][2]['headers'] == {'Idempotency-Key': 'k-1'} and session.closed
@@ -1,11 +1,13 @@
 # tests/test_core/test_cache.py
 
+import time
 import pytest
 from django.core.cache import cache
 from django.utils import timezone
 from decimal import Decimal
 from apps.core.models import CacheEntry
 from apps.core.cache import CacheService # فرض بر این است که کلاس CacheService وجود دارد
+from apps.core.cache import IndicatorResultCache, canonicalize_indicator_params
 from apps.core.helpers import mask_sensitive_data # فرض بر این است که تابع mask وجود دارد
 
 pytestmark = pytest.mark.django_db
@@ -237,3 +239,75 @@ class TestCacheHelpers:
         pass # فقط نمونه، اگر تابع وجود داشت، تست می‌کردیم
 
 logger.info("Core cache tests loaded successfully.")
+
+
+class TestIndicatorResultCache:
+    """
+    Tests for the content-addressed indicator result cache.
+    """
+    @pytest.fixture
+    def result_cache(self):
+        return IndicatorResultCache(max_entries=100, use_redis=False)
+
+    def test_equivalent_params_share_key(self):
+        assert canonicalize_indicator_params({'Period': '20', 'std_dev': 2.0}) == {'period': 20, 'std_dev': 2}
+        key_a = IndicatorResultCache.make_key(1, '1h', 'ema', {'period': 20}, 1000)
+        key_b = IndicatorResultCache.make_key(1, '1h', 'EMA', {'period': 20.0}, 1000)
+        assert key_a == key_b
+        assert key_a != IndicatorResultCache.make_key(1, '1h', 'EMA', {'period': 21}, 1000)
+
+    def test_get_or_compute_computes_once(self, result_cache):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return {'value': 42.5}
+
+        for _ in range(3):
+            assert result_cache.get_or_compute(1, '1h', 'EMA', {'period': 20}, 1000, compute) == {'value': 42.5}
+        assert len(calls) == 1
+
+    def test_lru_eviction_by_entry_count(self):
+        result_cache = IndicatorResultCache(max_entries=2, use_redis=False)
+        for ts in (1, 2, 3):
+            result_cache.set(1, '1m', 'SMA', {'period': 5}, ts, ts * 1.0)
+        assert result_cache.get(1, '1m', 'SMA', {'period': 5}, 1) is None
+        assert result_cache.get(1, '1m', 'SMA', {'period': 5}, 3) == 3.0
+
+    def test_new_bar_invalidates_only_its_series(self, result_cache):
+        result_cache.on_bar(1, '1h', 1000)
+        result_cache.set(1, '1h', 'EMA', {'period': 20}, 1000, 1.0)
+        result_cache.set(2, '1h', 'EMA', {'period': 20}, 1000, 2.0)
+
+        assert result_cache.on_bar(1, '1h', 2000) == 1
+        assert result_cache.get(1, '1h', 'EMA', {'period': 20}, 1000) is None
+        assert result_cache.get(2, '1h', 'EMA', {'period': 20}, 1000) == 2.0
+
+    def test_correction_invalidates_later_results(self, result_cache):
+        result_cache.on_bar(1, '1m', 3000)
+        for ts in (1000, 2000, 3000):
+            result_cache.set(1, '1m', 'RSI', {'period': 14}, ts, float(ts))
+
+        # اصلاح کندل 2000 -> نتایج 2000 و 3000 باطل، 1000 معتبر می‌ماند
+        assert result_cache.on_bar(1, '1m', 2000) == 2
+        assert result_cache.get(1, '1m', 'RSI', {'period': 14}, 1000) == 1000.0
+        assert result_cache.get(1, '1m', 'RSI', {'period': 14}, 3000) is None
+
+    def test_open_bar_results_are_not_kept_locally(self, result_cache):
+        open_bar_ts = int(time.time() * 1000) // 3_600_000 * 3_600_000
+        result_cache.set(1, '1h', 'EMA', {'period': 20}, open_bar_ts, 1.0)
+        result_cache.set(1, '1h', 'EMA', {'period': 20}, open_bar_ts - 3_600_000, 2.0)
+
+        assert result_cache.get(1, '1h', 'EMA', {'period': 20}, open_bar_ts) is None
+        assert result_cache.get(1, '1h', 'EMA', {'period': 20}, open_bar_ts - 3_600_000) == 2.0
+
+    def test_local_entries_expire_after_ttl(self, mocker):
+        result_cache = IndicatorResultCache(max_entries=100, use_redis=False, local_ttl_seconds=5)
+        monotonic = mocker.patch('apps.core.cache.time.monotonic', return_value=100.0)
+        result_cache.set(1, '1m', 'SMA', {'period': 5}, 1000, 1.0)
+
+        monotonic.return_value = 104.0
+        assert result_cache.get(1, '1m', 'SMA', {'period': 5}, 1000) == 1.0
+        # ممکن است در پروسس دیگری باطل شده باشد
+        monotonic.return_value = 106.0
+        assert result_cache.get(1, '1m', 'SMA', {'period': 5}, 1000) is None
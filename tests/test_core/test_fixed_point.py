@@ -0,0 +1,116 @@
+# tests/test_core/test_fixed_point.py
+
+import random
+from decimal import Decimal, ROUND_HALF_UP, localcontext
+
+import numpy as np
+import pytest
+
+from apps.core.fixed_point import (
+    FixedPointScale, decimal_places, format_scaled, notional_sum, parse_scaled, scaled_to_decimal,
+)
+from apps.core.helpers import round_to_tick_size, validate_tick_size
+
+STEPS = ['1', '0.5', '0.01', '0.05', '0.00001', '0.00000001', '25', '0.0000000000000001']
+
+
+def _random_decimal(rng, decimals):
+    return Decimal(rng.randint(-10 ** 14, 10 ** 14)).scaleb(-decimals)
+
+
+class TestFixedPointRoundTrip:
+    """
+    Property checks on seeded random inputs: conversions must be exact in both directions.
+    """
+
+    def test_decimal_round_trip(self):
+        rng = random.Random(20)
+        for _ in range(3000):
+            decimals = rng.randint(0, 18)
+            value = _random_decimal(rng, rng.randint(0, decimals))
+            units = parse_scaled(value, decimals)
+            assert scaled_to_decimal(units, decimals) == value
+            assert parse_scaled(str(value), decimals) == units
+            assert parse_scaled(format_scaled(units, decimals), decimals) == units
+            assert Decimal(format_scaled(units, decimals)) == value
+
+    def test_float_input_matches_its_repr(self):
+        rng = random.Random(21)
+        for _ in range(3000):
+            decimals = rng.randint(0, 10)
+            value = round(rng.uniform(-1e6, 1e6), rng.randint(0, decimals))
+            assert scaled_to_decimal(parse_scaled(value, decimals), decimals) == Decimal(repr(value))
+
+    def test_inexact_values_are_rejected(self):
+        for value in ('0.123', Decimal('0.123'), 0.123, '1e-3', float('inf'), Decimal('NaN'), None):
+            with pytest.raises(ValueError):
+                parse_scaled(value, 2)
+        assert parse_scaled('1.2000000', 1) == 12 and parse_scaled('-.5', 1) == -5
+
+
+class TestFixedPointScale:
+    def test_scale_follows_tick_and_lot(self):
+        scale = FixedPointScale.from_steps(Decimal('0.0500'), Decimal('0.001'))
+        assert (scale.price_decimals, scale.tick_units, scale.quantity_decimals, scale.lot_units) == (2, 5, 3, 1)
+        assert scale.tick_size == Decimal('0.05') and decimal_places(Decimal('1E+2')) == 0
+        assert FixedPointScale.from_steps() == FixedPointScale(8, 8, 1, 1)
+
+    def test_tick_validation_and_rounding_match_decimal(self):
+        rng = random.Random(22)
+        for _ in range(3000):
+            step = Decimal(rng.choice(STEPS))
+            scale = FixedPointScale.from_steps(step, step)
+            units = rng.randint(-10 ** 12, 10 ** 12)
+            price = scale.price(units)
+            assert scale.is_valid_price(units) == (price % step == 0)
+            expected = (price / step).quantize(Decimal('1'), rounding=ROUND_HALF_UP) * step
+            assert scale.price(scale.round_price(units)) == expected
+            assert scale.price(scale.floor_quantity(abs(units))) == (abs(price) // step) * step
+
+        scale = FixedPointScale.from_steps(Decimal('0.05'))
+        units = np.array([-12345, -5, 0, 7, 12, 12345], dtype=np.int64)
+        assert scale.round_prices(units).tolist() == [scale.round_price(int(u)) for u in units]
+        assert scale.valid_prices(units).tolist() == [True, True, True, False, False, True]
+
+    def test_notional_and_vwap_are_exact(self):
+        scale = FixedPointScale.from_steps(Decimal('0.01'), Decimal('0.00000001'))
+        prices = scale.price_array(['37251.01', '37260.55', '37255'])
+        quantities = scale.quantity_array(['0.5', '1.25', '0.00000001'])
+        assert prices.dtype == np.int64
+        expected = Decimal('37251.01') * Decimal('0.5') + Decimal('37260.55') * Decimal('1.25') + Decimal('37255') * Decimal('0.00000001')
+        assert scaled_to_decimal(notional_sum(prices, quantities), 10) == expected
+        assert scale.vwap(prices, quantities) == (expected / Decimal('1.75000001')).quantize(Decimal('0.01'), ROUND_HALF_UP)
+        assert scale.notional(prices[0], quantities[0]) == Decimal('18625.505')
+
+        # محصول‌های بزرگ (خارج از int64) با اعداد صحیح پایتون جمع می‌شوند
+        big = np.full(4, 4 * 10 ** 15, dtype=np.int64)
+        assert notional_sum(big, big) == 4 * (4 * 10 ** 15) ** 2
+
+
+class TestTickSizeHelpers:
+    """
+    validate_tick_size / round_to_tick_size use integer remainders and must agree with Decimal.
+    """
+
+    def test_match_decimal_on_random_prices(self):
+        rng = random.Random(23)
+        for _ in range(3000):
+            step = Decimal(rng.choice(STEPS))
+            price = _random_decimal(rng, rng.randint(0, 18))
+            with localcontext() as context:
+                # مرجع Decimal با دقت کافی برای قیمت‌های بزرگ و tick بسیار کوچک
+                context.prec = 60
+                remainder_is_zero = price % step == 0
+                expected = (price / step).quantize(Decimal('1'), rounding=ROUND_HALF_UP) * step
+            assert validate_tick_size(price, step) == remainder_is_zero
+            rounded = round_to_tick_size(price, step)
+            assert rounded == expected and validate_tick_size(rounded, step)
+
+    def test_examples_and_invalid_tick(self):
+        assert validate_tick_size(Decimal('123.45'), Decimal('0.01'))
+        assert not validate_tick_size(Decimal('123.456'), Decimal('0.01'))
+        assert not validate_tick_size(Decimal('1'), Decimal('0'))
+        assert round_to_tick_size(Decimal('123.456'), Decimal('0.01')) == Decimal('123.46')
+        assert round_to_tick_size(Decimal('0.125'), Decimal('0.05')) == Decimal('0.15')
+        with pytest.raises(ValueError):
+            round_to_tick_size(Decimal('1'), Decimal('-0.01'))
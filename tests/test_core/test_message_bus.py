@@ -0,0 +1,213 @@
+# tests/test_core/test_message_bus.py
+
+import asyncio
+from decimal import Decimal
+
+import pytest
+from apps.core.messaging import (
+    DEFAULT_MESSAGE_BUS, InProcessTransport, JsonCodec, Message, MessageBus, MessageParseError,
+    MsgpackCodec, RedisStreamTransport, get_codec,
+)
+from apps.core.metrics import metrics
+
+
+class FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+
+    def xadd(self, *args, **kwargs):
+        self.calls.append(('xadd', args, kwargs))
+
+    def xack(self, *args):
+        self.calls.append(('xack', args, {}))
+
+    async def execute(self):
+        self.client.round_trips += 1
+        return [await getattr(self.client, name)(*args, **kwargs) for name, args, kwargs in self.calls]
+
+
+class FakeStreams:
+    """
+    Minimal async Redis Streams: one group per stream, pending entries with delivery counts.
+    """
+
+    def __init__(self):
+        self.streams = {}
+        self.groups = {}
+        self.round_trips = 0
+        self.closed = False
+        self._seq = 0
+
+    async def aclose(self):
+        self.closed = True
+
+    def pipeline(self, transaction=False):
+        return FakePipeline(self)
+
+    async def xadd(self, key, fields, maxlen=None, approximate=True):
+        self._seq += 1
+        entry_id = f'{self._seq}-0'.encode()
+        self.streams.setdefault(key, []).append((entry_id, dict(fields)))
+        return entry_id
+
+    async def xgroup_create(self, key, group, id='$', mkstream=False):
+        if (key, group) in self.groups:
+            raise Exception('BUSYGROUP Consumer Group name already exists')
+        self.streams.setdefault(key, [])
+        self.groups[(key, group)] = {'last': len(self.streams[key]), 'pending': {}}
+
+    async def xreadgroup(self, group, consumer, streams, count=None, block=None):
+        (key, _), = streams.items()
+        state = self.groups[(key, group)]
+        entries = self.streams[key][state['last']:state['last'] + count]
+        state['last'] += len(entries)
+        for entry_id, _ in entries:
+            state['pending'][entry_id] = 1
+        if not entries:
+            await asyncio.sleep(block / 1000)
+        return [(key.encode(), entries)] if entries else []
+
+    async def xack(self, key, group, *ids):
+        pending = self.groups[(key, group)]['pending']
+        return sum(1 for entry_id in ids if pending.pop(entry_id, None) is not None)
+
+    async def xpending_range(self, key, group, min, max, count, idle=None):
+        return [{'message_id': entry_id, 'times_delivered': times}
+                for entry_id, times in self.groups[(key, group)]['pending'].items()][:count]
+
+    async def xclaim(self, key, group, consumer, min_idle_time, ids):
+        pending = self.groups[(key, group)]['pending']
+        for entry_id in ids:
+            pending[entry_id] += 1
+        return [entry for entry in self.streams[key] if entry[0] in ids]
+
+    async def xinfo_groups(self, key):
+        return [{'name': group.encode(), 'pending': len(state['pending']),
+                 'lag': len(self.streams[key]) - state['last']}
+                for (stream, group), state in self.groups.items() if stream == key]
+
+
+class TestCodecs:
+    def test_round_trip_and_parse_errors(self):
+        message = Message('ticks.BTCUSDT', {'price': Decimal('101.5'), 'qty': 2}, 'TICK', 'agent-1', 'corr-1')
+        codecs = [JsonCodec(), get_codec('msgpack')]
+        for codec in codecs:
+            decoded = codec.decode(codec.encode(message))
+            assert (decoded.topic, decoded.message_id, decoded.correlation_id) == ('ticks.BTCUSDT', message.message_id, 'corr-1')
+            assert decoded.payload == {'price': '101.5', 'qty': 2}
+            with pytest.raises(MessageParseError):
+                codec.decode(b'\xc1 not a message')
+        assert isinstance(codecs[1], MsgpackCodec)
+        assert len(codecs[1].encode(message)) < len(codecs[0].encode(message))
+        with pytest.raises(ValueError):
+            get_codec('xml')
+
+
+class TestInProcessBus:
+    def test_groups_fan_out_and_consumers_share_a_group(self):
+        metrics.reset('core.bus.')
+        bus = MessageBus(transport=InProcessTransport(queue_size=100))
+        received = {'strategy-a': [], 'strategy-b': [], 'risk': []}
+
+        async def scenario():
+            await bus.subscribe('ticks', lambda m: received['strategy-a'].append(m), group='strategy', block_ms=20)
+            await bus.subscribe('ticks', lambda m: received['strategy-b'].append(m), group='strategy', block_ms=20)
+
+            async def risk(message):
+                received['risk'].append(message)
+
+            await bus.subscribe('ticks', risk, group='risk', block_ms=20)
+            ids = await bus.publish_batch([('ticks', {'i': i}) for i in range(50)], message_type='TICK')
+            await asyncio.sleep(0.1)
+            await bus.close()
+            return ids
+
+        ids = asyncio.run(scenario())
+        strategy = received['strategy-a'] + received['strategy-b']
+        assert sorted(m.payload['i'] for m in strategy) == list(range(50))
+        assert received['strategy-a'] and received['strategy-b']
+        assert [m.message_id for m in received['risk']] == ids
+        # zero-copy: هر دو گروه همان شیء را دریافت می‌کنند
+        by_id = {m.message_id: m for m in received['risk']}
+        assert all(by_id[m.message_id] is m for m in strategy)
+        assert metrics.get_counter('core.bus.published.ticks') == 50
+        assert metrics.get_counter('core.bus.delivered.ticks') == 100
+        assert metrics.get_distribution('core.bus.latency_ms.ticks')['count'] == 100
+
+    def test_unsupported_broker_and_handler_errors(self):
+        with pytest.raises(ValueError, match="Unsupported broker type: kafka"):
+            MessageBus(broker_type='kafka')
+        bus = MessageBus(transport=InProcessTransport())
+        seen = []
+
+        def handler(message):
+            seen.append(message.payload)
+            if message.payload == 'bad':
+                raise RuntimeError('boom')
+
+        async def scenario():
+            subscription = await bus.subscribe('alerts', handler, block_ms=20)
+            await bus.publish('alerts', 'bad')
+            bus.publish_sync('alerts', 'good')
+            await asyncio.sleep(0.05)
+            await bus.close()
+            return subscription
+
+        subscription = asyncio.run(scenario())
+        assert seen == ['bad', 'good'] and subscription.stats == {'delivered': 1, 'errors': 1}
+        assert not subscription.is_running
+
+
+    def test_messages_without_a_consumer_group_are_counted_as_dropped(self):
+        metrics.reset('core.bus.')
+        bus = MessageBus(transport=InProcessTransport())
+        # هیچ مصرف‌کننده‌ای در این پروسس شروع نشده است
+        assert bus.publish_sync('orphan', {'i': 1})
+        assert metrics.get_counter('core.bus.dropped') == 1
+        assert metrics.get_counter('core.bus.published.orphan') == 0
+
+        async def scenario():
+            await bus.subscribe('ticks', lambda m: None, block_ms=20)
+            bus.publish_sync('ticks', {'i': 2})
+            bus.publish_sync('other', {'i': 3})
+            await bus.publish('other', {'i': 4})
+            await bus.close()
+
+        asyncio.run(scenario())
+        assert metrics.get_counter('core.bus.dropped') == 3
+        assert metrics.get_counter('core.bus.published.ticks') == 1
+
+class TestRedisStreamBus:
+    def test_pipelined_publish_ack_reclaim_and_dead_letter(self):
+        client = FakeStreams()
+        options = dict(DEFAULT_MESSAGE_BUS, max_deliveries=2, lag_interval_seconds=0.01)
+        transport = RedisStreamTransport(codec=get_codec('msgpack'), options=options, client=client)
+        bus = MessageBus(transport=transport, options=options)
+        attempts = {}
+
+        async def flaky(message):
+            attempts[message.payload] = attempts.get(message.payload, 0) + 1
+            if message.payload == 'poison' or (message.payload == 'retry' and attempts['retry'] == 1):
+                raise RuntimeError('not now')
+
+        async def scenario():
+            await transport.ensure_group('orders', 'execution')
+            await bus.subscribe('orders', flaky, group='execution', consumer='c1', block_ms=1)
+            round_trips = client.round_trips
+            await bus.publish_batch([('orders', 'ok'), ('orders', 'retry'), ('orders', 'poison')])
+            assert client.round_trips == round_trips + 1
+            for _ in range(50):
+                await asyncio.sleep(0.02)
+                if 'bus:orders:dead' in client.streams:
+                    break
+            lag = await transport.lag('orders', 'execution')
+            await bus.close()
+            return lag
+
+        lag = asyncio.run(scenario())
+        assert attempts == {'ok': 1, 'retry': 2, 'poison': 2}
+        assert client.groups[('bus:orders', 'execution')]['pending'] == {}
+        dead = client.streams['bus:orders:dead']
+        assert [transport.codec.decode(fields[b'm']).payload for _, fields in dead] == ['poison']
+        assert lag == 0 and client.closed
@@ -1,8 +1,10 @@
 # tests/test_core/test_messaging.py
 
+import asyncio
+
 import pytest
 from unittest.mock import patch, MagicMock, AsyncMock
-from apps.core.messaging import MessageBus, BaseAgent
+from apps.core.messaging import MessageBus, BaseAgent, RedisStreamTransport
 from apps.core.models import AuditLog
 from apps.accounts.factories import CustomUserFactory
 from apps.instruments.factories import InstrumentFactory
@@ -17,7 +19,7 @@ class TestMessageBus:
     @pytest.fixture
     def mock_redis_client(self, mocker):
         """
-        Fixture to mock the redis client used by MessageBus.
+        Fixture to mock the (sync) redis client used by MessageBus.publish_sync.
         """
         mock_redis_lib = mocker.patch('apps.core.messaging.redis')
         mock_instance = MagicMock()
@@ -29,23 +31,21 @@ class TestMessageBus:
         """
         Fixture to create a MessageBus instance with mocked broker.
         """
-        mb = MessageBus(broker_type='redis')
-        mb._broker_instance = mock_redis_client
-        return mb
+        return MessageBus(broker_type='redis')
+
+    def _sent_envelopes(self, message_bus, redis_client):
+        pipe = redis_client.pipeline.return_value
+        pipe.execute.assert_called_once()
+        codec = message_bus.transport.codec
+        return [(call.args[0], codec.decode(call.args[1][b'm'])) for call in pipe.xadd.call_args_list]
 
     def test_message_bus_initialization_with_redis(self, mocker):
         """
-        Test that the MessageBus initializes the correct broker (Redis).
+        Test that the MessageBus initializes the correct broker (Redis Streams).
         """
-        mock_redis_lib = mocker.patch('apps.core.messaging.redis')
-        mock_redis_instance = MagicMock()
-        mock_redis_lib.Redis.return_value = mock_redis_instance
-
         mb = MessageBus(broker_type='redis')
-
-        mock_redis_lib.Redis.assert_called_once()
-        # اطمینان از اینکه _broker_instance به نمونه صحیح اشاره دارد
-        assert mb._broker_instance == mock_redis_instance
+        assert isinstance(mb.transport, RedisStreamTransport)
+        assert mb.broker_type == 'redis'
 
     def test_message_bus_initialization_with_unsupported_broker(self):
         """
@@ -56,48 +56,40 @@ class TestMessageBus:
 
     def test_publish_to_redis(self, message_bus, mock_redis_client):
         """
-        Test publishing a message to Redis.
+        Test publishing a message to a Redis stream.
         """
         topic = 'test_topic'
         message = {'event': 'test_event', 'data': 'test_data'}
         sender_id = 'test_sender_123'
 
-        message_bus.publish(topic, message, sender_id=sender_id)
+        message_bus.publish_sync(topic, message, sender_id=sender_id)
 
-        # چک کردن فراخوانی publish در نمونه Redis
-        mock_redis_client.publish.assert_called_once()
-        call_args = mock_redis_client.publish.call_args
-        assert call_args[0][0] == topic # اولین آرگومان topic است
-        # دومین آرگومان باید JSON string شده envelope باشد
-        import json
-        sent_envelope_str = call_args[0][1]
-        sent_envelope = json.loads(sent_envelope_str)
-        assert sent_envelope['topic'] == topic
-        assert sent_envelope['message'] == message
-        assert sent_envelope['sender_id'] == sender_id
-        assert 'timestamp' in sent_envelope # فرض: زمان در envelope اضافه می‌شود
+        # یک XADD در stream مربوط به topic
+        (key, sent), = self._sent_envelopes(message_bus, mock_redis_client)
+        assert key == 'bus:test_topic'
+        assert sent.topic == topic
+        assert sent.payload == message
+        assert sent.sender_id == sender_id
+        assert sent.timestamp_ms > 0
 
-    def test_broadcast_to_redis(self, message_bus, mock_redis_client):
+    def test_broadcast_to_redis(self, message_bus):
         """
         Test broadcasting a message to all connected agents via Redis.
         """
         message = {'event': 'broadcast_event', 'data': 'broadcast_data'}
         sender_id = 'broadcaster_123'
-        exclude_list = ['exclude_agent_1']
-
-        message_bus.broadcast(message, sender_id=sender_id, exclude_senders=exclude_list)
-
-        # چک کردن فراخوانی publish در نمونه Redis برای کانال 'broadcast'
-        mock_redis_client.publish.assert_called_once()
-        call_args = mock_redis_client.publish.call_args
-        assert call_args[0][0] == 'broadcast' # topic باید broadcast باشد
-        import json
-        sent_envelope_str = call_args[0][1]
-        sent_envelope = json.loads(sent_envelope_str)
-        assert sent_envelope['message'] == message
-        assert sent_envelope['sender_id'] == sender_id
-        # assert sent_envelope['exclude_list'] == exclude_list # این فیلد ممکن است در envelope نباشد و فقط در منطق publish استفاده شود
 
+        async_client = MagicMock()
+        async_client.pipeline.return_value.execute = AsyncMock(return_value=[])
+        message_bus.transport._client = async_client
+        asyncio.run(message_bus.broadcast(message, sender_id=sender_id, exclude_senders=['exclude_agent_1']))
+        asyncio.run(message_bus.broadcast(message, sender_id='exclude_agent_1', exclude_senders=['exclude_agent_1']))
+
+        # فقط فرستنده مستثنا نشده منتشر می‌شود، روی stream 'broadcast'
+        (key, sent), = self._sent_envelopes(message_bus, async_client)
+        assert key == 'bus:broadcast'
+        assert sent.payload == message
+        assert sent.sender_id == sender_id
 
 class TestBaseAgent:
     """
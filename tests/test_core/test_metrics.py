@@ -0,0 +1,55 @@
+# tests/test_core/test_metrics.py
+
+import pytest
+from apps.core.metrics import MetricsRegistry
+
+
+class TestMetricsRegistry:
+    """
+    Tests for the in-process MetricsRegistry.
+    """
+    def test_counters_and_gauges(self):
+        registry = MetricsRegistry()
+        registry.incr('ingest.ticks')
+        registry.incr('ingest.ticks', 4)
+        registry.gauge('ingest.queue_depth', 12)
+
+        stats = registry.get_stats('ingest')
+        assert stats['counters']['ingest.ticks'] == 5
+        assert stats['gauges']['ingest.queue_depth'] == 12
+
+    def test_distribution_percentiles(self):
+        registry = MetricsRegistry()
+        for value in range(1, 101):
+            registry.observe('flush_latency_ms', value)
+
+        dist = registry.get_distribution('flush_latency_ms')
+        assert dist['count'] == 100
+        assert dist['avg'] == pytest.approx(50.5)
+        assert dist['max'] == 100
+        assert dist['p50'] in (50, 51)
+        assert dist['p99'] >= 99
+
+    def test_reservoir_is_bounded_but_totals_are_not(self):
+        registry = MetricsRegistry(reservoir_size=10)
+        for value in range(1000):
+            registry.observe('size', value)
+
+        dist = registry.get_distribution('size')
+        assert dist['count'] == 1000
+        assert dist['p50'] >= 990 # فقط نمونه‌های اخیر نگه داشته می‌شوند
+
+    def test_timer_records_milliseconds(self):
+        registry = MetricsRegistry()
+        with registry.timer('op_ms'):
+            pass
+        assert registry.get_distribution('op_ms')['count'] == 1
+
+    def test_reset_by_prefix(self):
+        registry = MetricsRegistry()
+        registry.incr('a.count')
+        registry.incr('b.count')
+        registry.reset('a.')
+
+        assert registry.get_counter('a.count') == 0
+        assert registry.get_counter('b.count') == 1
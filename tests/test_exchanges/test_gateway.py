@@ -0,0 +1,150 @@
+# tests/test_exchanges/test_gateway.py
+
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+from apps.agents.ingest import SpillStore
+from apps.exchanges import gateway as gateway_module
+from apps.exchanges.gateway import (
+    DEFAULT_EXECUTION_GATEWAY, ExecutionGateway, ExecutionGatewayClient, replay_failed_order_records,
+    write_order_records,
+)
+
+ORDER = {'symbol': 'BTCUSDT', 'side': 'buy', 'type': 'limit', 'amount': '0.001', 'price': '37260.55'}
+
+
+class FakeConnector:
+    def __init__(self, events, fail=False):
+        self.events = events
+        self.fail = fail
+        self.connected = False
+
+    def connect(self):
+        self.connected = True
+        self.events.append('connect')
+
+    def is_connected(self):
+        return self.connected
+
+    def disconnect(self):
+        self.connected = False
+
+    def place_order(self, symbol, side, order_type, quantity, price=None, **kwargs):
+        if self.fail:
+            raise RuntimeError('insufficient balance')
+        self.events.append(('sent', symbol, side, order_type, str(quantity), str(price), kwargs['client_order_id']))
+        return {'order_id': 12345, 'status': 'NEW'}
+
+
+def _gateway(tmp_path, events, records, fail=False, write_delay=0.0):
+    def account_loader(account_id):
+        events.append(('load', account_id))
+        return SimpleNamespace(id=account_id, owner_id=1, exchange_id=2, exchange=SimpleNamespace(code='BINANCE'))
+
+    def record_writer(batch):
+        time.sleep(write_delay)
+        events.append('recorded')
+        records.extend(batch)
+        return len(batch)
+
+    options = dict(DEFAULT_EXECUTION_GATEWAY, socket_path=str(tmp_path / 'gateway.sock'),
+                   ingest={'writers': 1, 'max_latency_ms': 1, 'spill_dir': str(tmp_path)})
+    return ExecutionGateway(options, account_loader=account_loader,
+                            connector_factory=lambda account: FakeConnector(events, fail), record_writer=record_writer)
+
+
+class TestExecutionGateway:
+    def test_order_is_sent_before_it_is_recorded(self, tmp_path):
+        events, records = [], []
+
+        async def scenario():
+            gateway = _gateway(tmp_path, events, records, write_delay=0.05)
+            await gateway.start(warm_account_ids=['acc-1'], serve=False)
+            assert events == [('load', 'acc-1'), 'connect']
+            reply = await gateway.handle_order({'account_id': 'acc-1', 'bot_id': 'bot-1', 'order': dict(ORDER),
+                                                'client_order_id': 'c-1', 'tick_ts': time.time() * 1000})
+            # پاسخ قبل از نوشتن در دیتابیس برمی‌گردد
+            assert 'recorded' not in events
+            await gateway.close()
+            return reply
+
+        reply = asyncio.run(scenario())
+        assert reply['status'] == 'sent' and reply['exchange_order_id'] == '12345'
+        assert set(reply['latency_ms']) == {'received_to_sent', 'exchange_ack', 'tick_to_sent'}
+        assert events[2] == ('sent', 'BTCUSDT', 'BUY', 'LIMIT', '0.001', '37260.55', 'c-1')
+        assert events[-1] == 'recorded'
+        assert len(records) == 1 and records[0]['status'] == 'NEW' and records[0]['bot_id'] == 'bot-1'
+
+    def test_rejections_are_replied_and_recorded(self, tmp_path):
+        events, records = [], []
+
+        async def scenario():
+            gateway = _gateway(tmp_path, events, records, fail=True)
+            await gateway.start(serve=False)
+            missing = await gateway.handle_order({'account_id': 'acc-1', 'order': {'symbol': 'BTCUSDT'}})
+            failed = await gateway.handle_order({'account_id': 'acc-1', 'order': dict(ORDER)})
+            stats = gateway.get_stats()
+            await gateway.close()
+            return missing, failed, stats
+
+        missing, failed, stats = asyncio.run(scenario())
+        assert missing['status'] == 'rejected' and 'side' in missing['error']
+        assert failed['status'] == 'rejected' and failed['error'] == 'insufficient balance'
+        # سفارش ناموفق ثبت می‌شود؛ درخواست نامعتبر هرگز به صرافی نرفته است
+        assert [record['status'] for record in records] == ['REJECTED']
+        assert stats['rejected'] == 2 and stats['sessions'] == 1
+
+    def test_unix_socket_round_trip(self, tmp_path):
+        events, records = [], []
+        ready, done = threading.Event(), threading.Event()
+        box = {}
+
+        async def serve():
+            gateway = _gateway(tmp_path, events, records)
+            await gateway.start(serve=True)
+            box['gateway'] = gateway
+            ready.set()
+            while not done.is_set():
+                await asyncio.sleep(0.01)
+            await gateway.close()
+
+        thread = threading.Thread(target=lambda: asyncio.run(serve()))
+        thread.start()
+        assert ready.wait(5)
+        client = ExecutionGatewayClient(socket_path=str(tmp_path / 'gateway.sock'), timeout=5)
+        replies = [client.place_order('acc-9', dict(ORDER), bot_id=7, client_order_id=f'c-{i}') for i in range(3)]
+        done.set()
+        thread.join(5)
+
+        assert [reply['client_order_id'] for reply in replies] == ['c-0', 'c-1', 'c-2']
+        assert all(reply['status'] == 'sent' for reply in replies)
+        assert [event for event in events if event[0] == 'load'] == [('load', 'acc-9')]
+        assert len(records) == 3 and box['gateway'].get_stats()['sent'] == 3
+
+
+class TestWriteOrderRecords:
+    def test_failed_record_is_spilled_without_aborting_the_batch(self, tmp_path, monkeypatch):
+        written, attempts = [], {}
+        broken = {'c-1'}
+
+        def write_one(record, instruments):
+            attempts[record['client_order_id']] = attempts.get(record['client_order_id'], 0) + 1
+            if record['client_order_id'] in broken:
+                raise RuntimeError('deadlock detected')
+            written.append(record['client_order_id'])
+
+        monkeypatch.setattr(gateway_module, '_write_order_record', write_one)
+        store = SpillStore(str(tmp_path), 1024 * 1024)
+        records = [{'client_order_id': f'c-{i}'} for i in range(3)]
+
+        # یک رکورد خراب بقیه batch را متوقف نمی‌کند و پس از چند تلاش روی دیسک می‌ماند
+        assert write_order_records(records, failed_store=store) == 2
+        assert written == ['c-0', 'c-2']
+        assert attempts['c-1'] == DEFAULT_EXECUTION_GATEWAY['record_attempts'] and len(store) == 1
+
+        broken.clear()
+        writer = lambda batch: write_order_records(batch, failed_store=store)  # noqa: E731
+        assert replay_failed_order_records(writer, failed_store=store) == 1
+        assert written == ['c-0', 'c-2', 'c-1'] and len(store) == 0
@@ -0,0 +1,197 @@
+# tests/test_instruments/test_indicator_engine.py
+
+import numpy as np
+import pytest
+from apps.instruments.exceptions import IndicatorValidationError
+from apps.instruments.indicator_engine import (
+    IndicatorEngine,
+    StreamingIndicator,
+    _bar_at,
+    get_indicator_class,
+)
+from apps.market_data.storage import OHLCVArrays
+
+
+def _random_bars(count=300, seed=7):
+    rng = np.random.default_rng(seed)
+    close = 100 + np.cumsum(rng.normal(0, 1, count))
+    high = close + rng.uniform(0, 2, count)
+    low = close - rng.uniform(0, 2, count)
+    return OHLCVArrays(
+        timestamp=np.arange(count, dtype=np.int64) * 60_000,
+        open_price=np.r_[close[0], close[:-1]],
+        high_price=high,
+        low_price=low,
+        close_price=close,
+        volume=rng.uniform(1, 5, count),
+    )
+
+
+def _slice(arrays, start, stop):
+    return OHLCVArrays(**{name: getattr(arrays, name)[start:stop] for name in OHLCVArrays.__slots__})
+
+
+INDICATOR_CASES = [
+    ('SMA', {'period': 20}),
+    ('EMA', {'period': 20}),
+    ('RSI', {'period': 14}),
+    ('ATR', {'period': 14}),
+    ('BBANDS', {'period': 20, 'std_dev': 2}),
+]
+
+
+class TestStreamingIndicators:
+    """
+    Streaming (O(1) per bar) results must match the vectorized warm-up path.
+    """
+    @pytest.mark.parametrize('code,params', INDICATOR_CASES)
+    def test_streaming_matches_vectorized_warm_up(self, code, params):
+        bars = _random_bars()
+        vectorized = get_indicator_class(code)(**params).warm_up(bars)
+
+        streaming = get_indicator_class(code)(**params)
+        outputs = [streaming.on_bar(_bar_at(bars, i)) for i in range(len(bars))]
+
+        for index, output in enumerate(outputs):
+            expected = {name: values[index] for name, values in vectorized.items()}
+            if output is None:
+                assert all(np.isnan(v) for v in expected.values())
+            else:
+                for name, value in output.items():
+                    assert value == pytest.approx(expected[name], rel=1e-9, abs=1e-9)
+
+    @pytest.mark.parametrize('code,params', INDICATOR_CASES)
+    def test_warm_up_then_stream_continues_series(self, code, params):
+        bars = _random_bars()
+        full = get_indicator_class(code)(**params).warm_up(bars)
+
+        indicator = get_indicator_class(code)(**params)
+        indicator.warm_up(_slice(bars, 0, 200))
+        for index in range(200, len(bars)):
+            output = indicator.on_bar(_bar_at(bars, index))
+        for name, value in output.items():
+            assert value == pytest.approx(full[name][-1], rel=1e-9)
+
+    @pytest.mark.parametrize('code,params', INDICATOR_CASES)
+    def test_state_round_trip(self, code, params):
+        bars = _random_bars()
+        original = get_indicator_class(code)(**params)
+        original.warm_up(_slice(bars, 0, 150))
+
+        restored = StreamingIndicator.from_state(original.get_state())
+        for index in range(150, 200):
+            expected = original.on_bar(_bar_at(bars, index))
+            assert restored.on_bar(_bar_at(bars, index)) == pytest.approx(expected)
+
+    @pytest.mark.parametrize('code,params', INDICATOR_CASES)
+    def test_same_timestamp_update_replaces_the_open_bar(self, code, params):
+        bars = _random_bars()
+        vectorized = get_indicator_class(code)(**params).warm_up(bars)
+
+        indicator = get_indicator_class(code)(**params)
+        for index in range(len(bars)):
+            bar = _bar_at(bars, index)
+            # نخستین چاپ کندل باز با قیمت متفاوت؛ به‌روزرسانی بعدی با همان timestamp باید جایگزین آن شود
+            indicator.on_bar(dict(bar, high=bar['high'] + 5, close=bar['close'] + 3))
+            output = indicator.on_bar(bar)
+        for name, value in output.items():
+            assert value == pytest.approx(vectorized[name][-1], rel=1e-9)
+
+    def test_old_bars_are_ignored(self):
+        indicator = get_indicator_class('SMA')(period=2)
+        bars = _random_bars(5)
+        for index in range(3):
+            indicator.on_bar(_bar_at(bars, index))
+        value = indicator.value
+        assert indicator.on_bar(_bar_at(bars, 1)) == value
+
+    def test_unknown_code_raises(self):
+        with pytest.raises(IndicatorValidationError):
+            get_indicator_class('NOPE')
+
+
+class _FakeParams:
+    def all(self):
+        return []
+
+
+class _FakeIndicator:
+    code = 'EMA'
+    parameters = _FakeParams()
+
+
+class _FakeTemplate:
+    id = 42
+    indicator = _FakeIndicator()
+    parameters = {'period': 10}
+
+
+class TestIndicatorEngine:
+    """
+    Tests for per-series state tracking and snapshot restore.
+    """
+    def test_on_candle_updates_registered_series_only(self, mocker):
+        mocker.patch.object(IndicatorEngine, 'restore', return_value=None)
+        mocker.patch.object(IndicatorEngine, 'sync_subscriptions', return_value=0)
+        engine = IndicatorEngine(snapshot_interval_seconds=3600)
+        bars = _random_bars(50)
+        engine.register_template(1, '1m', _FakeTemplate(), history=_slice(bars, 0, 40))
+
+        results = engine.on_candle(1, '1m', _bar_at(bars, 40))
+        assert set(results) == {42}
+        assert engine.on_candle(1, '5m', _bar_at(bars, 40)) == {}
+
+    def test_last_history_bar_can_be_replaced_after_registration(self, mocker):
+        mocker.patch.object(IndicatorEngine, 'restore', return_value=None)
+        mocker.patch.object(IndicatorEngine, 'sync_subscriptions', return_value=0)
+        engine = IndicatorEngine(snapshot_interval_seconds=3600)
+        bars = _random_bars(50)
+        partial = _slice(bars, 0, 50)
+        partial.close_price = partial.close_price.copy()
+        partial.close_price[-1] += 10
+        engine.register_template(1, '1m', _FakeTemplate(), history=partial)
+
+        # کندل باز تاریخچه بعداً با قیمت بسته‌شدن واقعی به‌روزرسانی می‌شود
+        result = engine.on_candle(1, '1m', _bar_at(bars, 49))[42]
+        expected = get_indicator_class('EMA')(period=10).warm_up(bars)['value'][-1]
+        assert result['value'] == pytest.approx(expected)
+
+    def test_snapshot_restore_replays_only_newer_bars(self, mocker):
+        bars = _random_bars(60)
+        source = get_indicator_class('EMA')(period=10)
+        source.warm_up(_slice(bars, 0, 40))
+        mocker.patch.object(IndicatorEngine, 'restore', return_value=StreamingIndicator.from_state(source.get_state()))
+        on_bar = mocker.spy(StreamingIndicator, 'on_bar')
+
+        engine = IndicatorEngine(snapshot_interval_seconds=3600)
+        indicator = engine.register_template(1, '1m', _FakeTemplate(), history=bars)
+
+        assert on_bar.call_count == 20
+        expected = get_indicator_class('EMA')(period=10).warm_up(bars)['value'][-1]
+        assert indicator.value['value'] == pytest.approx(expected)
+
+    def test_build_indicator_loads_only_the_warm_up_window(self, mocker):
+        mocker.patch.object(IndicatorEngine, 'restore', return_value=None)
+        bars = _random_bars(300)
+        load = mocker.patch('apps.instruments.indicator_engine.load_indicator_history', return_value=bars)
+
+        indicator = IndicatorEngine().build_indicator(1, '1m', _FakeTemplate())
+
+        load.assert_called_once_with(1, '1m', bars=101, since_ts=None)
+        assert indicator.last_ts == int(bars.timestamp[-1])
+
+    def test_subscribed_templates_are_tracked_by_the_ingesting_process(self, mocker):
+        bars = _random_bars(50)
+        source = get_indicator_class('EMA')(period=10)
+        source.warm_up(_slice(bars, 0, 40))
+        subscriptions = mocker.patch.object(IndicatorEngine, '_read_subscriptions', return_value={42})
+        mocker.patch.object(IndicatorEngine, '_load_templates', return_value=[_FakeTemplate()])
+        mocker.patch.object(IndicatorEngine, 'build_indicator', return_value=source)
+        engine = IndicatorEngine(snapshot_interval_seconds=3600)
+
+        assert set(engine.on_candle(1, '1m', _bar_at(bars, 40))) == {42}
+
+        # اشتراک حذف شده است؛ همگام‌سازی بعدی ردیابی را متوقف می‌کند
+        subscriptions.return_value = set()
+        engine.sync_subscriptions(1, '1m')
+        assert not engine.is_tracking(1, '1m', 42)
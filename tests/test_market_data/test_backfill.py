@@ -0,0 +1,172 @@
+# tests/test_market_data/test_backfill.py
+
+import threading
+from types import SimpleNamespace
+
+import numpy as np
+from apps.connectors.rate_limiter import BucketSpec, InMemoryRateLimiterBackend, RateLimiter, ip_bucket_key
+from apps.market_data.backfill import (
+    BackfillEngine,
+    indexes_to_ranges,
+    missing_ranges,
+    ranges_to_indexes,
+    split_range,
+    upsert_candles,
+)
+
+MINUTE = 60_000
+
+
+def _config(backfill=None):
+    source = SimpleNamespace(name='Binance', base_url='', rate_limit_per_minute=100_000,
+                             config={'backfill': backfill or {'concurrency': 3, 'chunk_candles': 10}})
+    return SimpleNamespace(id=1, instrument_id=7, timeframe='1m', data_source=source)
+
+
+class FakeSyncLog:
+    def __init__(self, details=None):
+        self.details = details or {}
+        self.records_synced = 0
+        self.status = None
+        self.end_time = None
+        self.error_message = ''
+        self.saves = 0
+
+    def save(self, update_fields=None):
+        self.saves += 1
+
+
+class FakeExchange:
+    """
+    Serves 1m candles for [0, listed_until); pages are capped at page_size.
+    """
+
+    def __init__(self, listed_until, page_size=1000, fail_starts=()):
+        self.listed_until = listed_until
+        self.page_size = page_size
+        self.fail_starts = set(fail_starts)
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, config, start_ms, end_ms, limit, timeout):
+        with self._lock:
+            self.requests += 1
+        if start_ms in self.fail_starts:
+            raise ConnectionError('boom')
+        stop = min(end_ms + 1, self.listed_until)
+        opens = range(start_ms, stop, MINUTE)
+        return [{'timestamp': ts, 'open': 1, 'high': 2, 'low': 0.5, 'close': 1.5, 'volume': 3}
+                for ts in list(opens)[:min(limit, self.page_size)]]
+
+
+class Store:
+    def __init__(self):
+        self.timestamps = set()
+        self.empty = []
+
+    def write(self, config, candles):
+        self.timestamps.update(candle['timestamp'] for candle in candles)
+        return len(candles)
+
+    def gaps(self, config, start_ms, end_ms):
+        return missing_ranges(np.array(sorted(self.timestamps), dtype=np.int64), start_ms, end_ms, MINUTE)
+
+    def record_empty(self, config, ranges):
+        self.empty.extend(ranges)
+
+
+def _ip_specs(config, weight):
+    # همان باکت IP کانکتور صرافی (ip_bucket_key(exchange.id))
+    return [BucketSpec(ip_bucket_key(42), 100_000, 100_000 / 60.0, weight)]
+
+
+def _engine(exchange, store, now_ms=10 ** 13, rate_limiter=None):
+    return BackfillEngine(
+        fetcher=exchange, writer=store.write,
+        gap_finder=store.gaps, empty_recorder=store.record_empty,
+        rate_limiter=rate_limiter or RateLimiter(backend=InMemoryRateLimiterBackend()),
+        rate_limit_specs=_ip_specs,
+        wall_clock=lambda: now_ms / 1000, sleep=lambda seconds: None,
+    )
+
+
+class TestBackfillHelpers:
+    def test_split_range_aligns_to_bars(self):
+        assert split_range(30_000, 25 * MINUTE, MINUTE, 10) == [(0, 10 * MINUTE), (10 * MINUTE, 20 * MINUTE), (20 * MINUTE, 25 * MINUTE)]
+
+    def test_missing_ranges(self):
+        stored = np.array([0, 1, 2, 5, 6, 9]) * MINUTE
+        assert missing_ranges(stored, 0, 12 * MINUTE, MINUTE) == [(3 * MINUTE, 5 * MINUTE), (7 * MINUTE, 9 * MINUTE), (10 * MINUTE, 12 * MINUTE)]
+        assert missing_ranges(np.array([], dtype=np.int64), 0, 2 * MINUTE, MINUTE) == [(0, 2 * MINUTE)]
+
+    def test_index_ranges_round_trip(self):
+        assert indexes_to_ranges([5, 0, 1, 2, 6]) == [[0, 2], [5, 6]]
+        assert ranges_to_indexes([[0, 2], [5, 6]]) == {0, 1, 2, 5, 6}
+
+
+class TestBackfillEngine:
+    def test_concurrent_backfill_with_short_pages(self):
+        exchange, store = FakeExchange(listed_until=95 * MINUTE, page_size=4), Store()
+        sync_log = FakeSyncLog()
+        state = _engine(exchange, store).run(_config(), sync_log, start_ms=0, end_ms=100 * MINUTE)
+        assert store.timestamps == set(range(0, 95 * MINUTE, MINUTE))
+        assert state['candles'] == 95 and state['progress'] == 100.0
+        assert state['completed'] == [[0, 9]] and state['failed'] == []
+        assert sync_log.status == 'SUCCESS' and sync_log.records_synced == 95
+        assert 'candles_per_second' in sync_log.details['backfill']
+
+    def test_requests_draw_from_the_exchange_ip_bucket(self):
+        backend = InMemoryRateLimiterBackend()
+        exchange, store = FakeExchange(listed_until=20 * MINUTE), Store()
+        _engine(exchange, store, rate_limiter=RateLimiter(backend=backend)).run(_config(), FakeSyncLog(), start_ms=0, end_ms=20 * MINUTE)
+        assert list(backend.snapshot()) == [ip_bucket_key(42)]
+
+    def test_failed_chunk_is_resumed_from_checkpoint(self):
+        store = Store()
+        config = _config({'concurrency': 2, 'chunk_candles': 10, 'max_retries': 1})
+        sync_log = FakeSyncLog()
+        failing = FakeExchange(listed_until=30 * MINUTE, fail_starts={10 * MINUTE})
+        _engine(failing, store).run(config, sync_log, start_ms=0, end_ms=30 * MINUTE)
+        assert sync_log.status == 'PARTIAL'
+        assert sync_log.details['backfill']['failed'] == [[1, 1]]
+        assert len(store.timestamps) == 20
+
+        # اجرای دوباره با همان sync log فقط chunk ناموفق را دریافت می‌کند
+        healthy = FakeExchange(listed_until=30 * MINUTE)
+        state = _engine(healthy, store).run(config, sync_log)
+        assert healthy.requests == 1
+        assert sync_log.status == 'SUCCESS' and state['candles'] == 30
+        assert state['completed'] == [[0, 2]]
+
+    def test_fill_gaps_fetches_only_missing_candles(self):
+        store = Store()
+        store.timestamps.update(ts for ts in range(0, 40 * MINUTE, MINUTE) if not 12 * MINUTE <= ts < 15 * MINUTE)
+        engine = _engine(FakeExchange(listed_until=40 * MINUTE), store)
+        gaps = engine.find_gaps(_config(), 0, 40 * MINUTE)
+        assert gaps == [(12 * MINUTE, 15 * MINUTE)]
+        state = engine.run(_config(), FakeSyncLog(), ranges=gaps)
+        assert state['candles'] == 3
+        assert engine.find_gaps(_config(), 0, 40 * MINUTE) == []
+
+    def test_closed_ranges_without_candles_are_recorded_empty(self):
+        store = Store()
+        _engine(FakeExchange(listed_until=95 * MINUTE), store).run(_config(), FakeSyncLog(), start_ms=0, end_ms=100 * MINUTE)
+        assert store.empty == [(95 * MINUTE, 100 * MINUTE)]
+
+        # بازه‌ای که هنوز بسته نشده خالی ثبت نمی‌شود
+        recent = Store()
+        _engine(FakeExchange(listed_until=95 * MINUTE), recent, now_ms=96 * MINUTE).run(_config(), FakeSyncLog(), start_ms=0, end_ms=100 * MINUTE)
+        assert recent.empty == []
+
+
+class TestUpsertCandles:
+    def test_pages_run_the_shared_snapshot_hooks(self, mocker, MarketDataConfigFactory):
+        run_hooks = mocker.patch('apps.market_data.services.MarketDataService.run_snapshot_hooks')
+        config = MarketDataConfigFactory(data_type='OHLCV', timeframe='1m')
+        candle = {'open': '1', 'high': '2', 'low': '1', 'close': '2', 'volume': '5'}
+        candles = [dict(candle, timestamp=10 ** 12 + minute * MINUTE) for minute in range(3)]
+
+        assert upsert_candles(config, candles) == 3
+        run_hooks.assert_called_once()
+        assert len(run_hooks.call_args.args[1]) == 3
+        assert run_hooks.call_args.kwargs == {'update_hot_cache': False}
@@ -0,0 +1,53 @@
+# tests/test_market_data/test_coverage.py
+
+from apps.market_data.coverage import CoverageIndex, IntervalSet, timestamps_to_runs
+
+MINUTE = 60_000
+
+
+class TestIntervalSet:
+    def test_add_merges_touching_and_overlapping_intervals(self):
+        intervals = IntervalSet()
+        assert intervals.add(0, 10) == 10
+        assert intervals.add(20, 30) == 10
+        assert intervals.add(10, 20) == 10
+        assert intervals.to_list() == [[0, 30]]
+        assert intervals.add(5, 35) == 5
+        assert intervals.add(50, 60) == 10
+        assert intervals.to_list() == [[0, 35], [50, 60]]
+        assert intervals.contains(34) and not intervals.contains(35) and not intervals.contains(-1)
+
+    def test_missing_and_remove_before(self):
+        intervals = IntervalSet([[10, 20], [30, 40]])
+        assert intervals.missing(0, 50) == [(0, 10), (20, 30), (40, 50)]
+        assert intervals.missing(12, 18) == []
+        assert intervals.missing(15, 35) == [(20, 30)]
+        intervals.remove_before(15)
+        assert intervals.to_list() == [[15, 20], [30, 40]]
+        intervals.remove_before(25)
+        assert intervals.to_list() == [[30, 40]] and intervals.total() == 10
+
+
+class TestCoverageIndex:
+    def test_timestamps_to_runs(self):
+        timestamps = [0, MINUTE, 2 * MINUTE, 5 * MINUTE, MINUTE]
+        assert timestamps_to_runs(timestamps, MINUTE) == [(0, 3 * MINUTE), (5 * MINUTE, 6 * MINUTE)]
+        assert timestamps_to_runs([], MINUTE) == []
+
+    def test_missing_ranges_skip_known_empty_ranges(self):
+        index = CoverageIndex(MINUTE)
+        assert index.add_bars([ts * MINUTE for ts in range(10) if ts not in (3, 4, 7)]) == 7
+        assert index.add_bars([0, MINUTE]) == 0
+        assert index.bar_count == 7
+        assert index.missing_ranges(0, 12 * MINUTE) == [(3 * MINUTE, 5 * MINUTE), (7 * MINUTE, 8 * MINUTE), (10 * MINUTE, 12 * MINUTE)]
+        index.add_empty(2 * MINUTE, 5 * MINUTE)
+        assert index.empty.to_list() == [[3 * MINUTE, 5 * MINUTE]]
+        assert index.missing_ranges(0, 12 * MINUTE) == [(7 * MINUTE, 8 * MINUTE), (10 * MINUTE, 12 * MINUTE)]
+
+    def test_report_aligns_window_to_bars(self):
+        index = CoverageIndex(MINUTE, intervals=[[0, 8 * MINUTE]], bar_count=8)
+        report = index.report(30_000, 10 * MINUTE + 1)
+        assert report['start'] == MINUTE and report['end'] == 11 * MINUTE
+        assert report['expected_bars'] == 10 and report['missing_bars'] == 3
+        assert report['missing_ranges'] == [[8 * MINUTE, 11 * MINUTE]] and not report['is_complete']
+        assert index.report(0, 8 * MINUTE)['completeness'] == 1.0
@@ -0,0 +1,104 @@
+# tests/test_market_data/test_hot_cache.py
+
+import asyncio
+from types import SimpleNamespace
+
+from apps.market_data.hot_cache import HotMarketStateCache, InMemoryMarketStateBackend
+
+
+class CountingBackend(InMemoryMarketStateBackend):
+    def __init__(self):
+        super().__init__()
+        self.writes = 0
+        self.reads = 0
+
+    def write_many(self, states, aliases):
+        self.writes += 1
+        super().write_many(states, aliases)
+
+    def read(self, config_id):
+        self.reads += 1
+        return super().read(config_id)
+
+
+def _config(config_id='c1', symbol='BTCUSDT', timeframe='1m', source='Binance'):
+    return SimpleNamespace(
+        id=config_id, timeframe=timeframe,
+        instrument=SimpleNamespace(symbol=symbol),
+        data_source=SimpleNamespace(name=source, config={}),
+    )
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestHotMarketStateCache:
+    def test_latest_price_candle_and_book(self):
+        cache = HotMarketStateCache(backend=InMemoryMarketStateBackend(), local_ttl_ms=1000)
+        config = _config()
+        cache.update(config, 'OHLCV', {'open': 1, 'close': 101.5})
+        assert cache.get_latest_price('btcusdt')[0] == 101.5
+        assert cache.get_latest_candle('BTCUSDT', '1m')['close'] == 101.5
+        cache.update(config, 'TICK', {'price': '102', 'quantity': '1'})
+        assert cache.get_latest_price('BTCUSDT', source='binance')[0] == 102.0
+        cache.update(config, 'ORDER_BOOK', {'bids': [[99, 1]], 'asks': [[101, 1]]})
+        assert cache.get_latest_book('BTCUSDT')['asks'] == [[101, 1]]
+        assert cache.get_latest_price('BTCUSDT')[0] == 100.0
+        assert cache.get_latest_price('ETHUSDT') is None
+        assert cache.get_latest_price('BTCUSDT', max_age_ms=-1) is None
+
+    def test_serialized_snapshot_round_trips_unchanged(self):
+        cache = HotMarketStateCache(backend=InMemoryMarketStateBackend(), local_ttl_ms=0)
+        # شکل خروجی MarketDataSnapshotSerializer (اعداد Decimal به صورت رشته)
+        row = {'id': 'a1', 'config': 'c1', 'timestamp': '2024-03-04T00:00:00Z',
+               'open_price': '100.00000000', 'close_price': '101.50000000', 'volume': '3.00000000'}
+        cache.update(_config(), 'OHLCV', row)
+        assert cache.get_latest_candle('BTCUSDT', '1m') == row
+        assert cache.get_latest_price('BTCUSDT')[0] == 101.5
+
+    def test_local_lru_serves_reads_within_ttl(self):
+        backend, clock = CountingBackend(), FakeClock()
+        writer = HotMarketStateCache(backend=backend)
+        reader = HotMarketStateCache(backend=backend, local_ttl_ms=500, clock=clock)
+        writer.update(_config(), 'TICK', {'price': 10})
+        for _ in range(5):
+            assert reader.get_latest_price('BTCUSDT')[0] == 10.0
+        assert backend.reads == 1
+        # به‌روزرسانی پروسس دیگر پس از انقضای TTL محلی دیده می‌شود
+        writer.update(_config(), 'TICK', {'price': 11})
+        assert reader.get_latest_price('BTCUSDT')[0] == 10.0
+        clock.now = 1.0
+        assert reader.get_latest_price('BTCUSDT')[0] == 11.0
+
+    def test_writes_coalesce_per_event_loop_iteration(self):
+        backend = CountingBackend()
+        cache = HotMarketStateCache(backend=backend)
+
+        async def burst():
+            for index in range(100):
+                cache.update(_config(f'c{index % 10}', symbol=f'S{index % 10}'), 'TICK', {'price': index})
+            # قبل از flush، خواندن همین پروسس تغییرات در انتظار را می‌بیند
+            assert cache.get_latest_price('S9')[0] == 99.0
+            await asyncio.sleep(0)
+
+        asyncio.run(burst())
+        assert backend.writes == 1
+        assert backend.read('c3')['price'] == '93.0'
+
+    def test_batch_and_dirty_checkpoint(self):
+        backend = CountingBackend()
+        cache = HotMarketStateCache(backend=backend)
+        with cache.batch():
+            cache.update(_config('a'), 'TICK', {'price': 1})
+            cache.update(_config('b', symbol='ETHUSDT'), 'OHLCV', {'close': 2})
+        assert backend.writes == 1
+        dirty = cache.pop_dirty()
+        assert sorted(dirty) == ['a', 'b']
+        snapshots = cache.snapshot_for_checkpoint(dirty)
+        assert snapshots['b']['candle'] == {'close': 2} and snapshots['b']['price'] == 2.0
+        assert cache.pop_dirty() == []
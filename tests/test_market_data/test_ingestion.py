@@ -0,0 +1,181 @@
+# tests/test_market_data/test_ingestion.py
+
+import pytest
+from decimal import Decimal
+from django.utils import timezone
+from apps.core.metrics import metrics
+from apps.market_data.ingestion import (
+    MAX_FLUSH_RETRIES,
+    TickBatcher,
+    TickIngestionBuffer,
+    get_tick_batching_settings,
+    DEFAULT_TICK_BATCHING,
+)
+from apps.market_data.models import MarketDataTick
+
+pytestmark = pytest.mark.django_db
+
+
+def _tick_row(trade_id, price='100.5', seconds=0):
+    return {
+        'timestamp': timezone.now() + timezone.timedelta(seconds=seconds),
+        'price': Decimal(price),
+        'quantity': Decimal('0.25'),
+        'side': 'BUY',
+        'trade_id': trade_id,
+    }
+
+
+class TestTickBatchingSettings:
+    """
+    Tests for resolving per-DataSource batching settings.
+    """
+    def test_defaults_when_not_configured(self, DataSourceFactory):
+        source = DataSourceFactory(config={})
+        assert get_tick_batching_settings(source) == DEFAULT_TICK_BATCHING
+
+    def test_source_overrides(self, DataSourceFactory):
+        source = DataSourceFactory(config={'tick_batching': {'enabled': True, 'max_batch_size': 50}})
+        resolved = get_tick_batching_settings(source)
+        assert resolved['enabled'] is True
+        assert resolved['max_batch_size'] == 50
+        assert resolved['max_latency_ms'] == DEFAULT_TICK_BATCHING['max_latency_ms']
+
+
+class TestTickBatcher:
+    """
+    Tests for the per-config TickBatcher.
+    """
+    def test_flushes_on_size_threshold(self, MarketDataConfigFactory, mocker):
+        config = MarketDataConfigFactory(data_type='TICK')
+        mock_emit = mocker.patch.object(TickBatcher, '_emit_batch_event')
+        batcher = TickBatcher(config, max_batch_size=3, max_latency_ms=60_000)
+
+        assert batcher.add(_tick_row('t1')) == 0
+        assert batcher.add(_tick_row('t2')) == 0
+        assert batcher.add(_tick_row('t3')) == 3
+
+        assert MarketDataTick.objects.filter(config=config).count() == 3
+        assert len(batcher) == 0
+        mock_emit.assert_called_once() # یک رویداد برای کل بچ
+
+    def test_flush_if_due_respects_latency(self, MarketDataConfigFactory, mocker):
+        config = MarketDataConfigFactory(data_type='TICK')
+        mocker.patch.object(TickBatcher, '_emit_batch_event')
+        batcher = TickBatcher(config, max_batch_size=100, max_latency_ms=50)
+        batcher.add(_tick_row('t1'))
+
+        mock_time = mocker.patch('apps.market_data.ingestion.time.monotonic')
+        mock_time.return_value = batcher._first_added_at + 0.01
+        assert batcher.flush_if_due() == 0
+
+        mock_time.return_value = batcher._first_added_at + 0.06
+        assert batcher.flush_if_due() == 1
+
+    def test_duplicate_trade_ids_are_dropped(self, MarketDataConfigFactory, mocker):
+        config = MarketDataConfigFactory(data_type='TICK')
+        mocker.patch.object(TickBatcher, '_emit_batch_event')
+        batcher = TickBatcher(config, max_batch_size=100, max_latency_ms=60_000)
+
+        batcher.add(_tick_row('dup'))
+        batcher.add(_tick_row('dup'))
+        batcher.add(_tick_row(None))
+        assert batcher.flush() == 2
+
+        # تیک تکراری در flush بعدی توسط constraint نادیده گرفته می‌شود
+        batcher.add(_tick_row('dup'))
+        batcher.flush()
+        assert MarketDataTick.objects.filter(config=config, trade_id='dup').count() == 1
+
+    def test_flush_records_metrics(self, MarketDataConfigFactory, mocker):
+        config = MarketDataConfigFactory(data_type='TICK')
+        mocker.patch.object(TickBatcher, '_emit_batch_event')
+        metrics.reset('market_data.tick_batch')
+        batcher = TickBatcher(config, max_batch_size=100, max_latency_ms=60_000)
+        batcher.add(_tick_row('m1'))
+        batcher.add(_tick_row('m2'))
+        batcher.flush()
+
+        stats = metrics.get_stats('market_data.tick_batch')
+        assert stats['counters']['market_data.tick_batch.flushes'] == 1
+        assert stats['distributions']['market_data.tick_batch.size']['max'] == 2
+        assert stats['distributions']['market_data.tick_batch.flush_latency_ms']['count'] == 1
+
+    def test_failed_flush_requeues_rows(self, MarketDataConfigFactory, mocker):
+        config = MarketDataConfigFactory(data_type='TICK')
+        mocker.patch.object(TickBatcher, '_emit_batch_event')
+        metrics.reset('market_data.tick_batch')
+        batcher = TickBatcher(config, max_batch_size=100, max_latency_ms=60_000, max_pending_rows=100)
+        batcher.add(_tick_row('r1'))
+        batcher.add(_tick_row('r2'))
+
+        mocker.patch.object(MarketDataTick.objects, 'bulk_create', side_effect=RuntimeError('db down'))
+        assert batcher.flush() == 0
+        assert len(batcher) == 2
+        stats = metrics.get_stats('market_data.tick_batch')
+        assert stats['counters']['market_data.tick_batch.ticks_requeued'] == 2
+
+        mocker.stopall()
+        mocker.patch.object(TickBatcher, '_emit_batch_event')
+        assert batcher.flush() == 2
+        assert MarketDataTick.objects.filter(config=config, trade_id__in=['r1', 'r2']).count() == 2
+
+    def test_exhausted_retries_drop_only_failing_rows(self, MarketDataConfigFactory, mocker):
+        config = MarketDataConfigFactory(data_type='TICK')
+        mocker.patch.object(TickBatcher, '_emit_batch_event')
+        metrics.reset('market_data.tick_batch')
+        batcher = TickBatcher(config, max_batch_size=100, max_latency_ms=60_000, max_pending_rows=100)
+        for trade_id in ('g1', 'bad', 'g2', 'g3'):
+            batcher.add(_tick_row(trade_id))
+
+        bulk_create = MarketDataTick.objects.bulk_create
+
+        def reject_bad_rows(objs, **kwargs):
+            if any(obj.trade_id == 'bad' for obj in objs):
+                raise RuntimeError('invalid row')
+            return bulk_create(objs, **kwargs)
+
+        mocker.patch.object(MarketDataTick.objects, 'bulk_create', side_effect=reject_bad_rows)
+        for _ in range(MAX_FLUSH_RETRIES):
+            assert batcher.flush() == 0
+        # پس از آخرین تلاش، بچ تقسیم می‌شود و فقط ردیف نامعتبر کنار گذاشته می‌شود
+        assert batcher.flush() == 3
+        assert len(batcher) == 0
+        assert set(MarketDataTick.objects.filter(config=config).values_list('trade_id', flat=True)) == {'g1', 'g2', 'g3'}
+        stats = metrics.get_stats('market_data.tick_batch')
+        assert stats['counters']['market_data.tick_batch.ticks_dropped'] == 1
+
+    def test_emit_batch_event_enqueues_one_task(self, MarketDataConfigFactory, mocker):
+        config = MarketDataConfigFactory(data_type='TICK')
+        mock_task = mocker.patch('apps.market_data.tasks.process_tick_batch_task.delay')
+        mocker.patch('apps.market_data.services.MarketDataService.update_cache_for_config')
+        batcher = TickBatcher(config, max_batch_size=2, max_latency_ms=60_000)
+
+        batcher.add(_tick_row('e1', seconds=0))
+        batcher.add(_tick_row('e2', seconds=1))
+
+        mock_task.assert_called_once()
+        args = mock_task.call_args[0]
+        assert args[0] == config.id
+        assert args[3] == 2
+
+
+class TestTickIngestionBuffer:
+    """
+    Tests for the process-wide TickIngestionBuffer.
+    """
+    def test_one_batcher_per_config_and_flush_all(self, MarketDataConfigFactory, mocker):
+        mocker.patch.object(TickBatcher, '_emit_batch_event')
+        mocker.patch.object(TickIngestionBuffer, '_ensure_flusher')
+        config_a = MarketDataConfigFactory(data_type='TICK')
+        config_b = MarketDataConfigFactory(data_type='TICK')
+        batching = {'enabled': True, 'max_batch_size': 100, 'max_latency_ms': 60_000}
+        buffer = TickIngestionBuffer()
+
+        buffer.submit(config_a, _tick_row('a1'), batching)
+        buffer.submit(config_a, _tick_row('a2'), batching)
+        buffer.submit(config_b, _tick_row('b1'), batching)
+        assert buffer.pending_count() == 3
+
+        assert buffer.flush_all() == 3
+        assert buffer.pending_count() == 0
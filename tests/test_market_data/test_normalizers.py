@@ -0,0 +1,97 @@
+# tests/test_market_data/test_normalizers.py
+
+import json
+import random
+from decimal import Decimal
+
+import numpy as np
+import pytest
+
+from apps.market_data.helpers import normalize_data_from_source
+from apps.market_data.normalizers import (
+    CANDLE_DTYPE, format_scaled, get_normalizer, parse_scaled, scaled_to_decimal,
+)
+
+BINANCE_KLINE = (
+    b'{"e":"kline","E":1700000012345,"s":"BTCUSDT","k":{"t":1700000000000,"T":1700000059999,'
+    b'"o":"37251.01000000","c":"37260.55000000","h":"37264.00000000","l":"37250.00000000",'
+    b'"v":"18.52417000","n":480,"x":false,"q":"690145.85284460","V":"9.87112000","Q":"367779.26930120"}}'
+)
+BINANCE_KLINE_ROW = [1700000000000, "37251.01", "37264.00", "37250.00", "37260.55", "18.52417",
+                     1700000059999, "690145.8528446", 480, "9.87112", "367779.2693012", "0"]
+LBANK_KBAR = (
+    '{"kbar":{"a":76412.7641,"c":37260.55,"t":"2023-11-14T22:13:00.000","v":2.0507,"h":37264.0,'
+    '"slot":"1min","l":37250.0,"n":41,"o":37251.01},"type":"kbar","pair":"btc_usdt"}'
+)
+
+
+class TestFixedPoint:
+    def test_parse_scaled_is_exact(self):
+        assert parse_scaled('37251.01000000') == 3725101000000
+        assert parse_scaled('0.1') == 10_000_000
+        assert parse_scaled('-.5', 2) == -50
+        assert parse_scaled(42, 2) == 4200
+        assert parse_scaled(6.3607, 4) == 63607
+        assert parse_scaled('1e-05') == 1000
+        assert parse_scaled('1.230000000000', 2) == 123
+        for bad in ('1.234', None, True, 'abc'):
+            with pytest.raises(ValueError):
+                parse_scaled(bad, 2)
+
+    def test_decimal_round_trip(self):
+        rng = random.Random(7)
+        for _ in range(2000):
+            scale = rng.randint(0, 10)
+            units = rng.randint(-10 ** 15, 10 ** 15)
+            text = format_scaled(units, scale)
+            assert parse_scaled(text, scale) == units
+            assert scaled_to_decimal(units, scale) == Decimal(text)
+            assert parse_scaled(scaled_to_decimal(units, scale), scale) == units
+
+    def test_float_fast_path_matches_repr(self):
+        rng = random.Random(11)
+        for _ in range(2000):
+            value = round(rng.uniform(-1e6, 1e6), rng.randint(0, 8))
+            assert parse_scaled(value) == int(Decimal(repr(value)).scaleb(8))
+        with pytest.raises(ValueError):
+            parse_scaled(float('nan'))
+
+
+class TestNormalizers:
+    def test_binance_kline_stream_and_rest_row(self):
+        normalizer = get_normalizer('binance', 'OHLCV')
+        candle = normalizer.decode_raw(BINANCE_KLINE)
+        assert (candle.timestamp, candle.close, candle.number_of_trades, candle.is_closed) == (
+            1700000000000, 3726055000000, 480, False)
+
+        normalized = normalizer.normalize(BINANCE_KLINE_ROW)
+        assert normalized['timestamp'] == 1700000000000 and normalized['close_time'] == 1700000059999
+        assert normalized['open'] == Decimal('37251.01') and normalized['quote_volume'] == Decimal('690145.8528446')
+        assert normalizer.normalize({'result': None, 'id': 1}) is None
+
+        array = normalizer.decode_array([BINANCE_KLINE_ROW, BINANCE_KLINE_ROW])
+        assert array.dtype == CANDLE_DTYPE and array['high'].tolist() == [3726400000000] * 2
+
+    def test_trade_sides_are_taker_sides(self):
+        binance = get_normalizer('BINANCE', 'TRADES').decode({'p': '1.5', 'q': '2', 'T': 1, 'm': True, 't': 9})
+        assert (binance.price, binance.side, binance.trade_id) == (150_000_000, 'SELL', 9)
+        nobitex = get_normalizer('NOBITEX', 'TICK').normalize(
+            {'time': 1700000012344, 'price': '1984100000', 'volume': '0.004512', 'type': 'buy'})
+        assert nobitex['side'] == 'BUY' and nobitex['price'] == Decimal('1984100000')
+
+    def test_nobitex_udf_history_and_lbank_kbar(self):
+        history = {'s': 'ok', 't': [1700000000, 1700000060], 'o': ['10', '11'], 'h': ['12', '12'],
+                   'l': ['9', '10'], 'c': ['11', '12'], 'v': ['0.5', '0.25']}
+        array = get_normalizer('NOBITEX', 'OHLCV').decode_array(history)
+        assert array['timestamp'].tolist() == [1700000000000, 1700000060000]
+        assert array['volume'].tolist() == [50_000_000, 25_000_000] and array.dtype == np.dtype(CANDLE_DTYPE)
+
+        normalized = get_normalizer('LBANK', 'OHLCV').normalize(json.loads(LBANK_KBAR), number=format_scaled)
+        assert normalized['timestamp'] == 1699999980000
+        assert normalized['open'] == '37251.01000000' and normalized['volume'] == '2.05070000'
+
+    def test_helpers_delegate_to_registry(self):
+        normalized = normalize_data_from_source({'k': BINANCE_KLINE_ROW}, 'Binance', 'OHLCV')
+        assert normalized['close'] == Decimal('37260.55') and normalized['number_of_trades'] == 480
+        assert normalize_data_from_source({}, 'UNKNOWN', 'OHLCV') == {}
+        assert normalize_data_from_source({'k': {'t': 1}}, 'BINANCE', 'OHLCV') is None
@@ -0,0 +1,101 @@
+# tests/test_market_data/test_order_book.py
+
+from types import SimpleNamespace
+
+import pytest
+from apps.market_data.exceptions import OrderBookChecksumError, OrderBookSequenceGapError
+from apps.market_data.order_book import LocalOrderBook, OrderBookEngine, crc32_checksum
+
+
+def _config(config_id=1, order_book=None):
+    source = SimpleNamespace(name='Binance', base_url='', config={'order_book': order_book or {'resync_cooldown_ms': 0}})
+    return SimpleNamespace(id=config_id, data_source=source, depth_levels=5)
+
+
+def _book():
+    book = LocalOrderBook(1)
+    book.load_snapshot(bids=[['99', '2'], ['100', '1'], ['98', '5']], asks=[['101', '3'], ['102', '1']], sequence=10, timestamp=1)
+    return book
+
+
+class TestLocalOrderBook:
+    def test_levels_are_sorted_best_first(self):
+        book = _book()
+        assert book.best_bid() == (100.0, 1.0)
+        assert book.best_ask() == (101.0, 3.0)
+        assert book.bids.top(3) == [(100.0, 1.0), (99.0, 2.0), (98.0, 5.0)]
+        assert book.asks.top(5) == [(101.0, 3.0), (102.0, 1.0)]
+        bid_prices, bid_qty = book.bids.to_arrays(2)
+        assert bid_prices.tolist() == [100.0, 99.0] and bid_qty.tolist() == [1.0, 2.0]
+
+    def test_apply_diff_updates_inserts_and_removes(self):
+        book = _book()
+        assert book.apply_diff(bids=[['100', '0'], ['100.5', '4']], asks=[['101', '0.5'], ['103', '2']], sequence=11, first_sequence=11)
+        assert book.best_bid() == (100.5, 4.0)
+        assert book.best_ask() == (101.0, 0.5)
+        assert len(book.bids) == 3 and len(book.asks) == 3
+        # diff قدیمی‌تر نادیده گرفته می‌شود
+        assert not book.apply_diff(bids=[['50', '1']], asks=[], sequence=11)
+        assert book.sequence == 11
+
+    def test_analytics(self):
+        book = _book()
+        assert book.mid_price() == 100.5
+        assert book.spread() == 1.0
+        assert book.microprice() == pytest.approx((100 * 3 + 101 * 1) / 4)
+        assert book.depth(2) == {'bids': 3.0, 'asks': 4.0}
+        assert book.imbalance(2) == pytest.approx((3 - 4) / 7)
+
+    def test_sequence_gap_raises(self):
+        book = _book()
+        with pytest.raises(OrderBookSequenceGapError):
+            book.apply_diff(bids=[], asks=[], sequence=15, first_sequence=13)
+        assert not book.is_synced
+
+    def test_checksum_validation(self):
+        book = _book()
+        book.checksum_fn = crc32_checksum
+        expected = crc32_checksum([(100.0, 1.0), (99.0, 2.0), (98.0, 5.0)], [(101.0, 2.0), (102.0, 1.0)])
+        assert book.apply_diff(bids=[], asks=[['101', '2']], sequence=11, checksum=expected)
+        with pytest.raises(OrderBookChecksumError):
+            book.apply_diff(bids=[['97', '1']], asks=[], sequence=12, checksum=expected)
+
+    def test_max_levels_trims_far_levels(self):
+        book = LocalOrderBook(1, max_levels=2)
+        book.load_snapshot(bids=[[1, 1], [2, 1], [3, 1]], asks=[[4, 1], [5, 1], [6, 1]])
+        assert book.bids.top(5) == [(3.0, 1.0), (2.0, 1.0)]
+        assert book.asks.top(5) == [(4.0, 1.0), (5.0, 1.0)]
+
+
+class TestOrderBookEngine:
+    def test_gap_triggers_resync_and_replays_buffered_diffs(self):
+        snapshots = [{'bids': [[100, 1]], 'asks': [[101, 1]], 'sequence': 20, 'timestamp': 5}]
+        persisted = []
+        engine = OrderBookEngine(
+            snapshot_fetcher=lambda config: snapshots.pop(0),
+            snapshot_interval_ms=60_000,
+            persist=lambda config, book: persisted.append(book.snapshot(config.depth_levels)),
+            clock=lambda: 1000.0,
+        )
+        config = _config()
+        engine.on_snapshot(config, {'bids': [[99, 1]], 'asks': [[102, 1]], 'sequence': 10, 'timestamp': 1})
+        engine.on_diff(config, {'bids': [[99, 2]], 'asks': [], 'first_sequence': 11, 'sequence': 11})
+        assert engine.get_book(1).best_bid() == (99.0, 2.0)
+
+        # شکاف: diff با sequence=21 پس از 11 -> resync از snapshot 20 و اعمال diff بافرشده
+        book = engine.on_diff(config, {'bids': [[100, 3]], 'asks': [], 'first_sequence': 21, 'sequence': 21})
+        assert book.is_synced and book.sequence == 21
+        assert book.best_bid() == (100.0, 3.0)
+        assert book.best_ask() == (101.0, 1.0)
+        # فقط یک snapshot در بازه ذخیره شده است
+        assert len(persisted) == 1
+
+    def test_unsynced_book_buffers_until_snapshot_available(self):
+        snapshots = [None, {'bids': [[10, 1]], 'asks': [[11, 1]], 'sequence': 5}]
+        engine = OrderBookEngine(snapshot_fetcher=lambda config: snapshots.pop(0), persist=lambda config, book: None)
+        config = _config()
+        book = engine.on_diff(config, {'bids': [[10, 2]], 'asks': [], 'first_sequence': 5, 'sequence': 6})
+        assert not book.is_synced
+        book = engine.on_diff(config, {'bids': [[9, 1]], 'asks': [], 'first_sequence': 7, 'sequence': 7})
+        assert book.is_synced and book.sequence == 7
+        assert book.bids.top(2) == [(10.0, 2.0), (9.0, 1.0)]
@@ -0,0 +1,61 @@
+# tests/test_market_data/test_order_book_codec.py
+
+import json
+
+import numpy as np
+import pytest
+from apps.market_data.order_book_codec import (
+    COMPRESSION_NONE,
+    COMPRESSION_ZLIB,
+    DEFAULT_SCALE,
+    LEVEL_DTYPE,
+    decode_order_book,
+    encode_order_book,
+    get_compression_name,
+)
+
+
+def _book(levels=500, seed=1):
+    rng = np.random.default_rng(seed)
+    bid_prices = np.round(30000.0 - np.cumsum(rng.integers(1, 4, levels)) * 0.01, 2)
+    ask_prices = np.round(30000.01 + np.cumsum(rng.integers(1, 4, levels)) * 0.01, 2)
+    bids = [[float(price), round(float(qty), 5)] for price, qty in zip(bid_prices, rng.uniform(0.001, 5, levels))]
+    asks = [[float(price), round(float(qty), 5)] for price, qty in zip(ask_prices, rng.uniform(0.001, 5, levels))]
+    return bids, asks
+
+
+class TestOrderBookCodec:
+    def test_round_trip_is_exact_on_tick_grid(self):
+        bids, asks = _book()
+        blob = encode_order_book(bids, asks, timestamp=1_700_000_000_000, sequence=42, tick_size=0.01, lot_size=0.00001)
+        decoded = decode_order_book(blob)
+        assert decoded.bids.dtype == LEVEL_DTYPE
+        assert decoded.timestamp == 1_700_000_000_000 and decoded.sequence == 42
+        assert decoded.price_scale == 0.01
+        assert decoded.bids['price'].tolist() == [level[0] for level in bids]
+        assert decoded.asks['quantity'].tolist() == [level[1] for level in asks]
+
+    def test_binary_is_much_smaller_than_json(self):
+        bids, asks = _book()
+        blob = encode_order_book(bids, asks, tick_size=0.01, lot_size=0.00001)
+        assert len(json.dumps({'bids': bids, 'asks': asks})) > 4 * len(blob)
+
+    def test_off_grid_values_fall_back_to_default_scale(self):
+        blob = encode_order_book([[100.005, 1.5]], [[100.013, 0.25]], tick_size=0.01, lot_size=1)
+        decoded = decode_order_book(blob)
+        assert decoded.price_scale == DEFAULT_SCALE
+        assert decoded.bids['price'][0] == pytest.approx(100.005, abs=1e-9)
+        assert decoded.asks['quantity'][0] == pytest.approx(0.25, abs=1e-9)
+        assert decoded.sequence is None
+
+    def test_compression_choice_and_empty_sides(self):
+        for compression, name in ((COMPRESSION_NONE, 'none'), (COMPRESSION_ZLIB, 'zlib')):
+            blob = encode_order_book([], [[5.0, 1.0]], compression=compression)
+            assert get_compression_name(blob) == name
+            decoded = decode_order_book(blob)
+            assert len(decoded.bids) == 0
+            assert decoded.to_lists()[1] == [(5.0, 1.0)]
+
+    def test_rejects_foreign_bytes(self):
+        with pytest.raises(ValueError):
+            decode_order_book(b'X' * 64)
@@ -0,0 +1,141 @@
+# tests/test_market_data/test_partitioning.py
+
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from apps.market_data.partitioning import (
+    INTERVAL_DAY,
+    INTERVAL_MONTH,
+    NativePartitionBackend,
+    PartitionManager,
+    dropped_until,
+    get_partitioning_settings,
+    next_boundary,
+    parse_partition_bound,
+    partition_name,
+    truncate_to_interval,
+)
+
+
+def _utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+class RecordingCursor:
+    """
+    Records executed SQL; answers the pg_inherits query with the given partitions.
+    """
+
+    def __init__(self, partitions, default_has_rows=False):
+        self.partitions = partitions
+        self.default_has_rows = default_has_rows
+        self.statements = []
+        self.rowcount = 0
+        self._rows = []
+
+    def execute(self, sql, params=None):
+        self.statements.append((' '.join(sql.split()), params))
+        self._rows = list(self.partitions) if 'pg_inherits' in sql else []
+        if sql.startswith('SELECT 1') and self.default_has_rows:
+            self._rows = [(1,)]
+        self.rowcount = 5 if sql.startswith('DELETE') and self.default_has_rows else 0
+
+    def fetchall(self):
+        return self._rows
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+
+def _backend():
+    return NativePartitionBackend(SimpleNamespace(ops=SimpleNamespace(quote_name=lambda name: f'"{name}"')))
+
+
+class TestPartitionBounds:
+    def test_truncate_and_next_boundary(self):
+        moment = _utc(2024, 12, 31, 15, 30)
+        assert truncate_to_interval(moment, INTERVAL_DAY) == _utc(2024, 12, 31)
+        assert truncate_to_interval(moment, INTERVAL_MONTH) == _utc(2024, 12, 1)
+        assert next_boundary(_utc(2024, 12, 1), INTERVAL_MONTH) == _utc(2025, 1, 1)
+        assert next_boundary(_utc(2024, 2, 28), INTERVAL_DAY) == _utc(2024, 2, 29)
+        assert partition_name('ticks', _utc(2024, 3, 5), INTERVAL_DAY) == 'ticks_p20240305'
+        assert partition_name('snaps', _utc(2024, 3, 1), INTERVAL_MONTH) == 'snaps_p202403'
+
+    def test_parse_partition_bound(self):
+        lower, upper = parse_partition_bound("FOR VALUES FROM ('2024-03-01 00:00:00+00') TO ('2024-04-01 00:00:00+00')")
+        assert lower == _utc(2024, 3, 1) and upper == _utc(2024, 4, 1)
+        assert parse_partition_bound("FOR VALUES FROM (MINVALUE) TO ('2024-01-01 00:00:00+00')") == (None, _utc(2024, 1, 1))
+        assert parse_partition_bound('DEFAULT') == (None, None)
+
+
+class TestNativePartitionBackend:
+    def test_ensure_partitions_continues_after_last_partition(self):
+        cursor = RecordingCursor([
+            ('ticks_legacy', "FOR VALUES FROM (MINVALUE) TO ('2024-03-05 00:00:00+00')"),
+            ('ticks_p20240305', "FOR VALUES FROM ('2024-03-05 00:00:00+00') TO ('2024-03-06 00:00:00+00')"),
+        ])
+        created = _backend().ensure_partitions(cursor, 'ticks', INTERVAL_DAY, premake=2, now=_utc(2024, 3, 5, 12))
+        assert created == ['ticks_p20240306', 'ticks_p20240307']
+        create_sql, params = cursor.statements[-1]
+        assert create_sql.startswith('CREATE TABLE IF NOT EXISTS "ticks_p20240307" PARTITION OF "ticks"')
+        assert params == [_utc(2024, 3, 7), _utc(2024, 3, 8)]
+
+    def test_drop_expired_detaches_whole_partitions_only(self):
+        cursor = RecordingCursor([
+            ('ticks_legacy', "FOR VALUES FROM (MINVALUE) TO ('2024-03-01 00:00:00+00')"),
+            ('ticks_p20240301', "FOR VALUES FROM ('2024-03-01 00:00:00+00') TO ('2024-03-02 00:00:00+00')"),
+            ('ticks_p20240302', "FOR VALUES FROM ('2024-03-02 00:00:00+00') TO ('2024-03-03 00:00:00+00')"),
+        ])
+        dropped = _backend().drop_expired(cursor, 'ticks', cutoff=_utc(2024, 3, 2, 6))
+        assert [info.name for info in dropped] == ['ticks_legacy', 'ticks_p20240301']
+        # ردیف‌های 2 مارس تا cutoff هنوز در ticks_p20240302 هستند
+        assert dropped_until(dropped) == _utc(2024, 3, 2)
+        statements = [sql for sql, _ in cursor.statements if not sql.startswith('SELECT')]
+        assert statements == [
+            'ALTER TABLE "ticks" DETACH PARTITION "ticks_legacy"',
+            'DROP TABLE "ticks_legacy"',
+            'ALTER TABLE "ticks" DETACH PARTITION "ticks_p20240301"',
+            'DROP TABLE "ticks_p20240301"',
+        ]
+
+    def test_default_partition_is_created_and_its_rows_moved(self):
+        cursor = RecordingCursor([
+            ('ticks_p20240305', "FOR VALUES FROM ('2024-03-05 00:00:00+00') TO ('2024-03-06 00:00:00+00')"),
+        ])
+        _backend().ensure_partitions(cursor, 'ticks', INTERVAL_DAY, premake=0, now=_utc(2024, 3, 5, 12))
+        assert cursor.statements[1][0] == 'CREATE TABLE IF NOT EXISTS "ticks_default" PARTITION OF "ticks" DEFAULT'
+
+        cursor = RecordingCursor([
+            ('ticks_default', 'DEFAULT'),
+            ('ticks_p20240305', "FOR VALUES FROM ('2024-03-05 00:00:00+00') TO ('2024-03-06 00:00:00+00')"),
+        ], default_has_rows=True)
+        created = _backend().ensure_partitions(cursor, 'ticks', INTERVAL_DAY, premake=1, now=_utc(2024, 3, 5, 12))
+        assert created == ['ticks_p20240306']
+        statements = [sql for sql, _ in cursor.statements[2:]]
+        assert statements[0].startswith('CREATE TABLE IF NOT EXISTS "ticks_p20240306" (LIKE "ticks"')
+        assert statements[1].startswith('WITH moved AS (DELETE FROM "ticks_default"')
+        assert statements[2].startswith('ALTER TABLE "ticks" ATTACH PARTITION "ticks_p20240306"')
+
+    def test_drop_expired_deletes_old_rows_of_default_partition(self):
+        cursor = RecordingCursor([('ticks_default', 'DEFAULT')], default_has_rows=True)
+        dropped = _backend().drop_expired(cursor, 'ticks', cutoff=_utc(2024, 3, 2))
+        assert [info.name for info in dropped] == ['ticks_default']
+        assert dropped_until(dropped) is None
+        assert cursor.statements[-1] == ('DELETE FROM "ticks_default" WHERE "timestamp" < %s', [_utc(2024, 3, 2)])
+
+
+class TestPartitioningSettings:
+    def test_retention_is_opt_in(self, settings):
+        settings.MARKET_DATA_PARTITIONING = {}
+        assert get_partitioning_settings('MarketDataTick')['retention_days'] is None
+        settings.MARKET_DATA_PARTITIONING = {'MarketDataTick': {'retention_days': 14}}
+        assert get_partitioning_settings('MarketDataTick')['retention_days'] == 14
+        assert get_partitioning_settings('MarketDataOrderBook')['retention_days'] is None
+
+    def test_retention_cutoff_follows_settings(self, settings):
+        manager = PartitionManager(clock=lambda: _utc(2024, 3, 31))
+        settings.MARKET_DATA_PARTITIONING = {}
+        assert manager.retention_cutoff('MarketDataSnapshot') is None
+        settings.MARKET_DATA_PARTITIONING = {'MarketDataSnapshot': {'retention_days': 30}}
+        assert manager.retention_cutoff('MarketDataSnapshot') == _utc(2024, 3, 1)
+        assert manager.retention_cutoff('MarketDataSnapshot', retention_days=1) == _utc(2024, 3, 30)
@@ -0,0 +1,117 @@
+# tests/test_market_data/test_resampling.py
+
+import numpy as np
+import pytest
+from datetime import datetime, timezone as dt_timezone
+from apps.market_data.resampling import (
+    IncrementalResampler,
+    bucket_starts,
+    get_bucket_offset_ms,
+    resample_ohlcv,
+    resample_ticks,
+    timeframe_to_ms,
+)
+from apps.market_data.storage import OHLCVArrays
+
+HOUR_MS = 3_600_000
+DAY_MS = 86_400_000
+
+
+def _minute_bars(count, start=datetime(2024, 3, 4, 0, 0, tzinfo=dt_timezone.utc)):
+    start_ms = int(start.timestamp() * 1000)
+    closes = np.arange(count, dtype=float) + 100
+    return OHLCVArrays(
+        timestamp=start_ms + np.arange(count, dtype=np.int64) * 60_000,
+        open_price=closes - 0.5,
+        high_price=closes + 1,
+        low_price=closes - 1,
+        close_price=closes,
+        volume=np.ones(count),
+    )
+
+
+class TestTimeframes:
+    def test_timeframe_to_ms(self):
+        assert timeframe_to_ms('1m') == 60_000
+        assert timeframe_to_ms('4h') == 4 * HOUR_MS
+        assert timeframe_to_ms('1w') == 7 * DAY_MS
+        with pytest.raises(ValueError):
+            timeframe_to_ms('1x')
+
+    def test_weekly_buckets_start_on_monday(self):
+        # 2024-03-06 چهارشنبه است -> شروع باکت هفتگی دوشنبه 2024-03-04
+        wednesday = int(datetime(2024, 3, 6, 15, tzinfo=dt_timezone.utc).timestamp() * 1000)
+        start = bucket_starts([wednesday], timeframe_to_ms('1w'), get_bucket_offset_ms('1w'))[0]
+        assert datetime.fromtimestamp(start / 1000, tz=dt_timezone.utc) == datetime(2024, 3, 4, tzinfo=dt_timezone.utc)
+
+    def test_exchange_alignment_uses_source_offset(self):
+        class Source:
+            config = {'candle_offset_minutes': -480} # بسته شدن کندل روزانه در UTC+8
+        assert get_bucket_offset_ms('1d', 'EXCHANGE', Source()) == -480 * 60_000
+        assert get_bucket_offset_ms('1d', 'UTC', Source()) == 0
+
+
+class TestResampleOHLCV:
+    def test_four_hour_buckets(self):
+        bars = _minute_bars(8 * 60) # 8 ساعت
+        result = resample_ohlcv(bars, '4h')
+
+        assert len(result) == 2
+        assert np.all(np.diff(result.timestamp) == 4 * HOUR_MS)
+        assert result.open_price[0] == bars.open_price[0]
+        assert result.close_price[0] == bars.close_price[239]
+        assert result.high_price[1] == bars.high_price[240:].max()
+        assert result.low_price[1] == bars.low_price[240:].min()
+        assert result.volume.sum() == 480
+
+    def test_daily_bucket_covers_whole_day(self):
+        bars = _minute_bars(DAY_MS // 60_000 + 30, start=datetime(2024, 3, 4, 0, 0, tzinfo=dt_timezone.utc))
+        result = resample_ohlcv(bars, '1d')
+        assert len(result) == 2
+        assert result.volume[0] == 1440
+        assert result.volume[1] == 30
+
+    def test_unsorted_input_is_handled(self):
+        bars = _minute_bars(10)
+        order = np.arange(10)[::-1]
+        shuffled = OHLCVArrays(**{name: getattr(bars, name)[order] for name in OHLCVArrays.__slots__})
+        result = resample_ohlcv(shuffled, '5m')
+        assert list(result.close_price) == [104.0, 109.0]
+
+    def test_resample_ticks(self):
+        base = int(datetime(2024, 3, 4, tzinfo=dt_timezone.utc).timestamp() * 1000)
+        result = resample_ticks([base, base + 1_000, base + 61_000], [10, 12, 11], [1, 2, 3], '1m')
+        assert list(result.open_price) == [10, 11]
+        assert list(result.high_price) == [12, 11]
+        assert list(result.volume) == [3, 3]
+
+    def test_fixed_point_ticks_stay_int64(self):
+        base = int(datetime(2024, 3, 4, tzinfo=dt_timezone.utc).timestamp() * 1000)
+        prices = np.array([3725101, 3725100, 3725199], dtype=np.int64)  # 0.01 tick
+        quantities = np.array([10 ** 17, 10 ** 17, 1], dtype=np.int64)  # بیش از دقت float64
+        result = resample_ticks([base, base + 1_000, base + 2_000], prices, quantities, '1m')
+        assert result.high_price.dtype == np.int64 and result.volume.dtype == np.int64
+        assert list(result.low_price) == [3725100] and list(result.volume) == [2 * 10 ** 17 + 1]
+
+
+class TestIncrementalResampler:
+    def test_incremental_matches_batch(self):
+        bars = _minute_bars(125)
+        expected = resample_ohlcv(bars, '15m')
+
+        resampler = IncrementalResampler('15m')
+        closed = []
+        for start in range(0, 125, 7):
+            chunk = OHLCVArrays(**{name: getattr(bars, name)[start:start + 7] for name in OHLCVArrays.__slots__})
+            closed.append(resampler.append(chunk))
+        closed.append(resampler.current_bucket)
+        result = OHLCVArrays.concatenate(closed)
+
+        for name in OHLCVArrays.__slots__:
+            assert np.allclose(getattr(result, name), getattr(expected, name))
+
+    def test_bucket_closes_on_last_source_bar(self):
+        resampler = IncrementalResampler('5m', source_timeframe='1m')
+        closed = resampler.append(_minute_bars(5))
+        assert len(closed) == 1
+        assert resampler.current_bucket is None
@@ -0,0 +1,154 @@
+# tests/test_market_data/test_rollups.py
+
+import pytest
+from datetime import datetime, timezone as dt_timezone
+from apps.market_data.models import MarketDataSnapshot
+from apps.market_data.rollups import CandleRollupEngine, InMemoryRollupStateBackend, RedisRollupStateBackend
+from apps.market_data.storage import ColumnarOHLCVStore
+
+pytestmark = pytest.mark.django_db
+
+BASE_MS = int(datetime(2024, 3, 4, 0, 0, tzinfo=dt_timezone.utc).timestamp() * 1000)
+
+
+def _candle(minute, close=None, volume=1.0):
+    close = float(100 + minute) if close is None else close
+    return {
+        'timestamp': BASE_MS + minute * 60_000,
+        'open': close - 0.5,
+        'high': close + 1,
+        'low': close - 1,
+        'close': close,
+        'volume': volume,
+    }
+
+
+@pytest.fixture
+def engine(tmp_path):
+    return CandleRollupEngine(
+        state_backend=InMemoryRollupStateBackend(),
+        timeframes=['5m', '1h'],
+        store=ColumnarOHLCVStore(str(tmp_path)),
+    )
+
+
+@pytest.fixture
+def source_config(MarketDataConfigFactory):
+    return MarketDataConfigFactory(timeframe='1m', data_type='OHLCV')
+
+
+class TestCandleRollupEngine:
+    """
+    Tests for incremental rollup of 1m candles.
+    """
+    def test_open_bucket_is_updated_incrementally(self, engine, source_config):
+        for minute in range(3):
+            engine.process_candle(source_config, _candle(minute))
+
+        bucket = engine.get_open_buckets(source_config)['5m']
+        assert bucket['timestamp'] == BASE_MS
+        assert bucket['open'] == 99.5
+        assert bucket['close'] == 102.0
+        assert bucket['high'] == 103.0
+        assert bucket['volume'] == 3.0
+
+    def test_bucket_is_persisted_when_next_bucket_starts(self, engine, source_config):
+        for minute in range(5):
+            assert engine.process_candle(source_config, _candle(minute)) == []
+        closed = engine.process_candle(source_config, _candle(5))
+
+        assert [bucket['timeframe'] for bucket in closed] == ['5m']
+        stored = engine.store.read_range(source_config.id, '5m')
+        assert len(stored) == 1
+        assert stored.volume[0] == 5.0
+        assert stored.close_price[0] == 104.0
+
+    def test_update_of_same_minute_replaces_last_bar(self, engine, source_config):
+        engine.process_candle(source_config, _candle(0))
+        engine.process_candle(source_config, _candle(1, close=101.0, volume=1.0))
+        engine.process_candle(source_config, _candle(1, close=110.0, volume=4.0)) # به‌روزرسانی همان دقیقه
+
+        bucket = engine.get_open_buckets(source_config)['5m']
+        assert bucket['close'] == 110.0
+        assert bucket['volume'] == 5.0
+
+    def test_late_candle_rerolls_only_closed_bucket(self, engine, source_config):
+        for minute in range(7):
+            engine.store.append_candle(source_config.id, '1m', **_as_store_kwargs(_candle(minute)))
+            engine.process_candle(source_config, _candle(minute))
+
+        # اصلاح کندل دقیقه 2 (در باکت بسته‌شده 00:00-00:05)
+        corrected = _candle(2, close=150.0, volume=10.0)
+        engine.store.append_candle(source_config.id, '1m', **_as_store_kwargs(corrected))
+        engine.process_candle(source_config, corrected)
+
+        stored = engine.store.read_range(source_config.id, '5m')
+        assert len(stored) == 1
+        assert stored.high_price[0] == 151.0
+        assert stored.volume[0] == 14.0
+        # باکت باز 1h نیز دست‌نخورده اما معتبر باقی می‌ماند
+        assert engine.get_open_buckets(source_config)['1h']['timestamp'] == BASE_MS
+
+    def test_closed_bucket_mirrors_to_target_config(self, engine, source_config, MarketDataConfigFactory):
+        target = MarketDataConfigFactory(
+            instrument=source_config.instrument,
+            data_source=source_config.data_source,
+            timeframe='5m',
+            data_type='OHLCV',
+        )
+        for minute in range(6):
+            engine.process_candle(source_config, _candle(minute))
+
+        snapshot = MarketDataSnapshot.objects.get(config=target)
+        assert snapshot.additional_data == {'rollup_source_config': str(source_config.id)}
+
+
+def _as_store_kwargs(candle):
+    return {
+        'timestamp': candle['timestamp'],
+        'open_price': candle['open'],
+        'high_price': candle['high'],
+        'low_price': candle['low'],
+        'close_price': candle['close'],
+        'volume': candle['volume'],
+    }
+
+
+class FakeLock:
+    def __init__(self, available):
+        self.available = available
+        self.held = False
+
+    def acquire(self):
+        self.held = self.available
+        return self.available
+
+    def release(self):
+        self.held = False
+
+
+class FakeLockClient:
+    def __init__(self, available=True):
+        self.locks = {}
+        self.available = available
+
+    def lock(self, name, timeout=None, blocking_timeout=None):
+        return self.locks.setdefault(name, FakeLock(self.available))
+
+
+class TestRedisRollupStateBackend:
+    """
+    Tests for the per-config lock around load-modify-save of open buckets.
+    """
+    def test_lock_is_held_per_config_and_released(self):
+        client = FakeLockClient()
+        backend = RedisRollupStateBackend(client=client)
+        with backend.locked(7):
+            assert client.locks['market_data:rollup:7:lock'].held
+        assert not client.locks['market_data:rollup:7:lock'].held
+
+    def test_lock_timeout_raises(self):
+        backend = RedisRollupStateBackend(client=FakeLockClient(available=False))
+        with pytest.raises(TimeoutError):
+            with backend.locked(7):
+                pass
@@ -0,0 +1,223 @@
+# tests/test_market_data/test_storage.py
+
+import os
+import numpy as np
+import pytest
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+from apps.market_data.storage import (
+    ColumnarOHLCVStore,
+    ROW_DTYPE,
+    load_ohlcv_arrays,
+    merge_records,
+    partition_for,
+)
+from apps.market_data.coverage import record_bars
+from apps.market_data.managers import MarketDataSnapshotQuerySet
+from apps.market_data.models import MarketDataSnapshot
+
+pytestmark = pytest.mark.django_db
+
+# 2024-01-31 23:00 UTC -> سه ساعت داده 1 دقیقه‌ای دو پارتیشن ماهانه را پوشش می‌دهد
+BASE_MS = int(datetime(2024, 1, 31, 23, 0, tzinfo=dt_timezone.utc).timestamp() * 1000)
+
+
+def _minute_records(count, start_ms=BASE_MS):
+    records = np.zeros(count, dtype=ROW_DTYPE)
+    records['timestamp'] = start_ms + np.arange(count, dtype=np.int64) * 60_000
+    records['open_price'] = np.arange(count, dtype=float)
+    records['high_price'] = records['open_price'] + 1
+    records['low_price'] = records['open_price'] - 1
+    records['close_price'] = records['open_price'] + 0.5
+    records['volume'] = 1.0
+    return records
+
+
+class TestColumnarOHLCVStore:
+    """
+    Tests for the file-based columnar OHLCV store.
+    """
+    def test_append_splits_into_monthly_partitions(self, tmp_path):
+        store = ColumnarOHLCVStore(str(tmp_path))
+        store.append(1, '1m', _minute_records(180))
+
+        assert store.list_partitions(1, '1m') == ['202401', '202402']
+        assert partition_for(BASE_MS) == '202401'
+
+    def test_read_range_is_inclusive_and_sorted(self, tmp_path):
+        store = ColumnarOHLCVStore(str(tmp_path))
+        records = _minute_records(180)
+        store.append(1, '1m', records[::-1].copy()) # ترتیب معکوس
+
+        arrays = store.read_range(1, '1m', BASE_MS + 59 * 60_000, BASE_MS + 61 * 60_000)
+        assert len(arrays) == 3
+        assert list(arrays.open_price) == [59.0, 60.0, 61.0]
+        assert np.all(np.diff(arrays.timestamp) > 0)
+
+    def test_compaction_produces_memmap_views_and_removes_journal(self, tmp_path):
+        store = ColumnarOHLCVStore(str(tmp_path))
+        store.append(1, '1m', _minute_records(30))
+        assert store.compact(1, '1m') == 1
+        assert not os.path.exists(tmp_path / '1' / '1m' / '202401.log')
+
+        arrays = store.read_range(1, '1m', BASE_MS, BASE_MS + 10 * 60_000)
+        assert isinstance(arrays.close_price.base, np.memmap) or isinstance(arrays.close_price, np.memmap)
+        assert len(arrays) == 11
+
+    def test_corrections_overwrite_previous_candle(self, tmp_path):
+        store = ColumnarOHLCVStore(str(tmp_path))
+        store.append(1, '1m', _minute_records(5))
+        store.compact(1, '1m')
+        store.append_candle(1, '1m', BASE_MS, Decimal('1'), Decimal('5'), Decimal('0.5'), Decimal('4'), Decimal('10'))
+
+        before = store.read_range(1, '1m')
+        store.compact(1, '1m')
+        after = store.read_range(1, '1m')
+        for arrays in (before, after):
+            assert len(arrays) == 5
+            assert arrays.close_price[0] == 4.0
+            assert arrays.volume[0] == 10.0
+
+    def test_merge_records_last_write_wins(self):
+        first = _minute_records(3)
+        second = _minute_records(1)
+        second['close_price'] = 99.0
+        merged = merge_records(first, second)
+        assert len(merged) == 3
+        assert merged['close_price'][0] == 99.0
+
+    def test_bounds_are_kept_in_store_metadata(self, tmp_path, mocker):
+        store = ColumnarOHLCVStore(str(tmp_path))
+        store.append(1, '1m', _minute_records(30, start_ms=BASE_MS + 60 * 60_000))
+        store.append(1, '1m', _minute_records(10))
+        store.compact(1, '1m')
+
+        read_partition = mocker.spy(store, 'read_partition')
+        assert store.first_timestamp(1, '1m') == BASE_MS
+        assert store.last_timestamp(1, '1m') == BASE_MS + 89 * 60_000
+        assert read_partition.call_count == 0
+
+
+class TestLoadOHLCVArrays:
+    """
+    Tests for the MarketDataSnapshot-compatible array read API.
+    """
+    def test_reads_from_store_when_available(self, tmp_path, MarketDataConfigFactory):
+        config = MarketDataConfigFactory(timeframe='1m', data_type='OHLCV')
+        store = ColumnarOHLCVStore(str(tmp_path))
+        store.append(config.id, '1m', _minute_records(10))
+
+        arrays = load_ohlcv_arrays(config, store=store)
+        assert len(arrays) == 10
+
+    def test_falls_back_to_database(self, tmp_path, MarketDataConfigFactory, MarketDataSnapshotFactory):
+        config = MarketDataConfigFactory(timeframe='1m', data_type='OHLCV')
+        MarketDataSnapshotFactory(config=config, volume=Decimal('2'))
+        MarketDataSnapshotFactory(config=config, volume=Decimal('3'))
+
+        arrays = load_ohlcv_arrays(config, store=ColumnarOHLCVStore(str(tmp_path)))
+        assert len(arrays) == 2
+        assert arrays.volume.sum() == pytest.approx(5.0)
+
+    def test_merges_database_rows_outside_the_stored_range(self, tmp_path, MarketDataConfigFactory,
+                                                           MarketDataSnapshotFactory):
+        config = MarketDataConfigFactory(timeframe='1m', data_type='OHLCV')
+        store = ColumnarOHLCVStore(str(tmp_path))
+        store.append(config.id, '1m', _minute_records(10, start_ms=BASE_MS + 60 * 60_000))
+        # کندل‌های قدیمی‌تر فقط در دیتابیس هستند
+        for minute in range(3):
+            MarketDataSnapshotFactory(
+                config=config,
+                timestamp=datetime.fromtimestamp((BASE_MS + minute * 60_000) / 1000, tz=dt_timezone.utc),
+                volume=Decimal('2'),
+            )
+
+        arrays = load_ohlcv_arrays(config, start=BASE_MS, end=BASE_MS + 69 * 60_000, store=store)
+        assert len(arrays) == 13
+        assert arrays.timestamp[0] == BASE_MS
+        assert np.all(np.diff(arrays.timestamp) > 0)
+
+    def test_fills_holes_inside_the_stored_range_from_database(self, tmp_path, MarketDataConfigFactory,
+                                                               MarketDataSnapshotFactory):
+        config = MarketDataConfigFactory(timeframe='1m', data_type='OHLCV')
+        records = _minute_records(10)
+        store = ColumnarOHLCVStore(str(tmp_path))
+        store.append(config.id, '1m', np.concatenate((records[:4], records[6:])))
+        # دقیقه‌های 4 و 5 فقط در دیتابیس هستند و ایندکس پوشش آن‌ها را ثبت کرده است
+        timestamps = [datetime.fromtimestamp((BASE_MS + minute * 60_000) / 1000, tz=dt_timezone.utc)
+                      for minute in range(10)]
+        for timestamp in timestamps[4:6]:
+            MarketDataSnapshotFactory(config=config, timestamp=timestamp, volume=Decimal('2'))
+        record_bars(config, timestamps)
+
+        arrays = load_ohlcv_arrays(config, store=store)
+        assert list(arrays.timestamp) == list(records['timestamp'])
+        assert list(arrays.volume[4:6]) == [2.0, 2.0]
+
+    def test_only_closed_candles_are_journaled(self, tmp_path, MarketDataConfigFactory):
+        config = MarketDataConfigFactory(timeframe='1m', data_type='OHLCV')
+        store = ColumnarOHLCVStore(str(tmp_path))
+
+        def upsert(minute, close):
+            snapshot, _ = MarketDataSnapshot.objects.update_or_create(
+                config=config,
+                timestamp=datetime.fromtimestamp((BASE_MS + minute * 60_000) / 1000, tz=dt_timezone.utc),
+                defaults={'open_price': Decimal('1'), 'high_price': Decimal('9'), 'low_price': Decimal('1'),
+                          'close_price': Decimal(close), 'volume': Decimal('1')},
+            )
+            return store.append_closed_snapshots(config, [snapshot], now_ms=BASE_MS + minute * 60_000 + 30_000)
+
+        # به‌روزرسانی‌های کندل باز در ژورنال نوشته نمی‌شوند
+        assert upsert(0, '1') == 0
+        assert upsert(0, '2') == 0
+        assert store.list_partitions(config.id, '1m') == []
+
+        # کندل بعدی کندل قبلی را با آخرین مقدارش می‌بندد
+        assert upsert(1, '5') == 1
+        assert upsert(1, '6') == 0
+        arrays = store.read_range(config.id, '1m')
+        assert list(arrays.timestamp) == [BASE_MS]
+        assert list(arrays.close_price) == [2.0]
+
+
+class TestCalculatePeriodicOHLC:
+    """
+    Tests for materialized-bucket reads in calculate_periodic_ohlc.
+    """
+    def test_range_before_first_materialized_bucket_is_resampled(self, tmp_path, settings, MarketDataConfigFactory):
+        settings.MARKET_DATA_COLUMNAR_ROOT = str(tmp_path)
+        config = MarketDataConfigFactory(timeframe='1m', data_type='OHLCV')
+        store = ColumnarOHLCVStore(str(tmp_path))
+        store.append(config.id, '1m', _minute_records(180))
+        # فقط ساعت آخر materialize شده است (مثلاً rollup پس از استقرار)
+        hour = _minute_records(1, start_ms=BASE_MS + 120 * 60_000)
+        store.append(config.id, '1h', hour)
+
+        start = datetime.fromtimestamp(BASE_MS / 1000, tz=dt_timezone.utc)
+        end = datetime.fromtimestamp((BASE_MS + 179 * 60_000) / 1000, tz=dt_timezone.utc)
+        queryset = MarketDataSnapshotQuerySet(MarketDataSnapshot)
+        candles = queryset.calculate_periodic_ohlc(config, start, end, aggregation_period='1h')
+
+        assert [int(candle['timestamp'].timestamp() * 1000) for candle in candles] == [
+            BASE_MS, BASE_MS + 60 * 60_000, BASE_MS + 120 * 60_000,
+        ]
+        assert candles[0]['open'] == Decimal('0.0')
+        assert candles[0]['close'] == Decimal('59.5')
+
+    def test_unaligned_start_returns_the_same_bars_on_both_paths(self, tmp_path, settings, MarketDataConfigFactory):
+        settings.MARKET_DATA_COLUMNAR_ROOT = str(tmp_path)
+        config = MarketDataConfigFactory(timeframe='1m', data_type='OHLCV')
+        store = ColumnarOHLCVStore(str(tmp_path))
+        store.append(config.id, '1m', _minute_records(180))
+        queryset = MarketDataSnapshotQuerySet(MarketDataSnapshot)
+        start = datetime.fromtimestamp((BASE_MS + 30 * 60_000) / 1000, tz=dt_timezone.utc)
+        end = datetime.fromtimestamp((BASE_MS + 179 * 60_000) / 1000, tz=dt_timezone.utc)
+
+        resampled = queryset.calculate_periodic_ohlc(config, start, end, aggregation_period='1h')
+        hours = _minute_records(3, start_ms=BASE_MS)
+        hours['timestamp'] = BASE_MS + np.arange(3, dtype=np.int64) * 3_600_000
+        store.append(config.id, '1h', hours)
+        materialized = queryset.calculate_periodic_ohlc(config, start, end, aggregation_period='1h')
+
+        assert [candle['timestamp'] for candle in resampled] == [candle['timestamp'] for candle in materialized]
+        assert int(resampled[0]['timestamp'].timestamp() * 1000) == BASE_MS
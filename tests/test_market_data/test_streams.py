@@ -0,0 +1,134 @@
+# tests/test_market_data/test_streams.py
+
+import asyncio
+import json
+import random
+from types import SimpleNamespace
+
+from apps.market_data.streams import MarketDataStreamManager, backoff_delay
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+        self.inbox = asyncio.Queue()
+        self.closed = False
+
+    async def send(self, message):
+        self.sent.append(json.loads(message))
+
+    async def close(self):
+        self.closed = True
+        await self.inbox.put(None)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        item = await self.inbox.get()
+        if item is None:
+            raise StopAsyncIteration
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+
+class FakeExchange:
+    def __init__(self):
+        self.sockets = []
+
+    async def connect(self, url):
+        socket = FakeWebSocket()
+        self.sockets.append(socket)
+        return socket
+
+
+def _source(source_id=1, max_streams=3):
+    return SimpleNamespace(id=source_id, name='Binance', ws_url='', config={'streaming': {'max_streams_per_connection': max_streams, 'backoff_base_seconds': 0.001, 'backoff_max_seconds': 0.002}})
+
+
+def _config(config_id, symbol, source, timeframe='1m', data_type='OHLCV'):
+    return SimpleNamespace(
+        id=config_id, data_source=source, data_source_id=source.id, timeframe=timeframe,
+        data_type=data_type, depth_levels=20, instrument=SimpleNamespace(symbol=symbol),
+    )
+
+
+def _subscribed(socket):
+    streams = set()
+    for message in socket.sent:
+        if message['method'] == 'SUBSCRIBE':
+            streams.update(message['params'])
+        else:
+            streams.difference_update(message['params'])
+    return streams
+
+
+async def _settle():
+    for _ in range(20):
+        await asyncio.sleep(0)
+
+
+class TestMarketDataStreamManager:
+    def test_packs_streams_and_routes_frames(self):
+        async def scenario():
+            exchange, received = FakeExchange(), []
+
+            async def handler(payload, config):
+                received.append((config.id, payload))
+
+            manager = MarketDataStreamManager(handler, connect=exchange.connect)
+            source = _source(max_streams=3)
+            configs = [_config(i, sym, source) for i, sym in enumerate(['BTCUSDT', 'ETHUSDT', 'BNBUSDT', 'XRPUSDT'])]
+            configs.append(_config(10, 'BTCUSDT', source)) # همان استریم -> بدون اشتراک تکراری
+            await manager.sync(configs)
+            await _settle()
+            assert manager.get_stats()['connections'] == 2
+            assert manager.get_stats()['streams'] == 4
+            first, second = exchange.sockets
+            assert _subscribed(first) == {'btcusdt@kline_1m', 'ethusdt@kline_1m', 'bnbusdt@kline_1m'}
+            assert _subscribed(second) == {'xrpusdt@kline_1m'}
+
+            await first.inbox.put(json.dumps({'stream': 'btcusdt@kline_1m', 'data': {'k': 1}}))
+            await first.inbox.put(json.dumps({'result': None, 'id': 1}))
+            await _settle()
+            assert sorted(received) == [(0, {'k': 1}), (10, {'k': 1})]
+            await manager.close()
+
+        asyncio.run(scenario())
+
+    def test_live_update_and_resubscribe_after_reconnect(self):
+        async def scenario():
+            exchange = FakeExchange()
+
+            async def handler(payload, config):
+                pass
+
+            manager = MarketDataStreamManager(handler, connect=exchange.connect, rng=random.Random(1))
+            source = _source(max_streams=10)
+            btc, eth = _config(1, 'BTCUSDT', source), _config(2, 'ETHUSDT', source)
+            await manager.sync([btc])
+            await _settle()
+            await manager.sync([btc, eth])
+            await manager.sync([eth, _config(3, 'ETHUSDT', source, data_type='TRADES')])
+            await _settle()
+            socket = exchange.sockets[0]
+            assert _subscribed(socket) == {'ethusdt@kline_1m', 'ethusdt@trade'}
+
+            await socket.inbox.put(ConnectionError('reset'))
+            await asyncio.sleep(0.05)
+            assert len(exchange.sockets) == 2
+            assert _subscribed(exchange.sockets[1]) == {'ethusdt@kline_1m', 'ethusdt@trade'}
+            assert manager.get_stats()['reconnects'] == 1
+
+            await manager.sync([])
+            assert manager.get_stats() == {'connections': 0, 'streams': 0, 'configs': 0, 'reconnects': 0}
+            await manager.close()
+
+        asyncio.run(scenario())
+
+    def test_backoff_is_jittered_and_capped(self):
+        rng = random.Random(7)
+        delays = [backoff_delay(attempt, 1.0, 30.0, rng) for attempt in range(12)]
+        assert all(0 <= delay <= min(30.0, 2 ** attempt) for attempt, delay in enumerate(delays))
+        assert len(set(delays)) == len(delays)